@@ -1072,6 +1072,22 @@ def create_app(config_name=None):
     # ==================== ROTA PARA SERVIR UPLOADS ====================
     from flask import send_from_directory, abort
 
+    @app.route("/uploads/midia/<handle>")
+    def serve_midia(handle):
+        """URL provisória de um upload do pipeline de mídia: redireciona para a
+        URL final quando pronto; antes disso, serve o arquivo do spool."""
+        from flask import redirect, send_file
+        from app.services.midia_service import MidiaService
+
+        midia = MidiaService.localizar(handle)
+        if not midia:
+            abort(404)
+        if midia["url"]:
+            return redirect(midia["url"])
+        if midia["caminho_spool"] and os.path.exists(midia["caminho_spool"]):
+            return send_file(midia["caminho_spool"], mimetype=midia["content_type"], max_age=0)
+        abort(404)
+
     @app.route("/uploads/<path:filename>")
     def serve_uploads(filename):
         """Serve arquivos da pasta uploads (logos, etc)"""
@@ -1134,6 +1150,69 @@ def create_app(config_name=None):
     except Exception as e:
         app.logger.error(f"Erro ao iniciar Cloud Push Scheduler: {e}")
 
+    # Agendador de alertas de estoque/validade (detecção incremental + e-mail em lote)
+    try:
+        from app.tasks.estoque_alerts_task import start_estoque_alerts_scheduler
+        start_estoque_alerts_scheduler(app)
+    except Exception as e:
+        app.logger.error(f"Erro ao iniciar agendador de alertas de estoque: {e}")
+
+    # Partições mensais futuras de vendas/itens/pagamentos/movimentações (só Postgres)
+    try:
+        from app.tasks.particoes_task import start_particoes_scheduler
+        start_particoes_scheduler(app)
+    except Exception as e:
+        app.logger.error(f"Erro ao iniciar agendador de partições: {e}")
+
+    # Acerto noturno do razão financeiro mensal (deltas fora do ORM)
+    try:
+        from app.tasks.financeiro_task import start_financeiro_scheduler
+        start_financeiro_scheduler(app)
+    except Exception as e:
+        app.logger.error(f"Erro ao iniciar agendador do razão financeiro: {e}")
+
+    # Recálculo periódico dos scores RFM (as telas só leem o snapshot)
+    try:
+        from app.tasks.rfm_task import start_rfm_scheduler
+        start_rfm_scheduler(app)
+    except Exception as e:
+        app.logger.error(f"Erro ao iniciar agendador RFM: {e}")
+
+    # Fila de emissão de NFC-e (workers em background; o PDV não espera a SEFAZ)
+    try:
+        from app.services.fiscal.fila_emissao import start_fila_emissao
+        start_fila_emissao(app)
+    except Exception as e:
+        app.logger.error(f"Erro ao iniciar fila de emissão de NFC-e: {e}")
+
+    # Fila de e-mails (envio SMTP com conexões reaproveitadas, fora das requisições)
+    try:
+        from app.services.email_fila import start_email_fila
+        start_email_fila(app)
+    except Exception as e:
+        app.logger.error(f"Erro ao iniciar fila de e-mails: {e}")
+
+    # Pipeline de mídia (fotos do ponto e documentos: spool → WebP → Cloudinary/disco)
+    try:
+        from app.services.midia_service import start_midia_pipeline
+        start_midia_pipeline(app)
+    except Exception as e:
+        app.logger.error(f"Erro ao iniciar pipeline de mídia: {e}")
+
+    # Exportações grandes em background (CSV/XLSX gerados fora da requisição)
+    try:
+        from app.services.exportacao_service import start_exportacoes
+        start_exportacoes(app)
+    except Exception as e:
+        app.logger.error(f"Erro ao iniciar workers de exportação: {e}")
+
+    # Importações em massa de CSV (produtos/clientes) processadas em blocos fora da requisição
+    try:
+        from app.services.importacao_service import start_importacoes
+        start_importacoes(app)
+    except Exception as e:
+        app.logger.error(f"Erro ao iniciar workers de importação: {e}")
+
     # ==================== CLI COMMANDS ====================
     # Registra comandos de gestão: flask push-to-aiven, flask sync-status
     try:
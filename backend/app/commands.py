@@ -147,3 +147,319 @@ def register_commands(app):
                 click.echo(f"[OK] {atualizados} produtos recalculados a partir do ledger.")
             else:
                 click.echo(f"[DRY-RUN] {atualizados} produtos seriam recalculados. Use --apply.")
+
+    @app.cli.command("recalcular-rfm")
+    @click.option("--janela", default=180, show_default=True, help="Janela de análise em dias.")
+    @with_appcontext
+    def recalcular_rfm(janela):
+        """Recalcula os scores RFM (clientes_rfm) de TODAS as lojas em uma única
+        passada. O agendador (app/tasks/rfm_task) faz o mesmo a cada
+        VALIDADE_HORAS; as telas só leem o snapshot."""
+        from app.services.rfm_service import RFMService
+
+        total = RFMService.recalcular_todos(janela_dias=janela)
+        click.echo(f"[OK] {total} clientes pontuados (janela {janela} dias).")
+
+    @app.cli.command("reconstruir-ponto-diario")
+    @click.option("--estabelecimento", type=int, default=None, help="Só esta loja (padrão: todas).")
+    @click.option("--desde", default=None, help="Data inicial YYYY-MM-DD (padrão: todo o histórico).")
+    @with_appcontext
+    def reconstruir_ponto_diario(estabelecimento, desde):
+        """Refaz o consolidado diário do ponto (ponto_diario) a partir das batidas.
+        Rodar uma vez após a migração; depois cada batida mantém a sua linha."""
+        from datetime import date
+        from app.services.ponto_diario_service import PontoDiarioService
+
+        inicio = date.fromisoformat(desde) if desde else None
+        total = PontoDiarioService.reconstruir(estabelecimento_id=estabelecimento, data_inicio=inicio)
+        click.echo(f"[OK] {total} dia(s) de ponto consolidados.")
+
+    @app.cli.command("verificar-banco-horas")
+    @click.option("--estabelecimento", type=int, default=None, help="Só esta loja (padrão: todas).")
+    @click.option("--desde", default=None, help="Data inicial YYYY-MM-DD (padrão: todo o histórico).")
+    @click.option("--ate", default=None, help="Data final YYYY-MM-DD.")
+    @click.option("--corrigir", is_flag=True, default=False, help="Grava lançamentos de reconciliação.")
+    @with_appcontext
+    def verificar_banco_horas(estabelecimento, desde, ate, corrigir):
+        """Confere o razão do banco de horas contra as batidas e justificativas.
+        Com --corrigir também faz a carga inicial do histórico após a migração."""
+        from datetime import date
+        from app.services.banco_horas_service import BancoHorasService
+
+        res = BancoHorasService.verificar(
+            estabelecimento_id=estabelecimento,
+            data_inicio=date.fromisoformat(desde) if desde else None,
+            data_fim=date.fromisoformat(ate) if ate else None,
+            corrigir=corrigir,
+        )
+        click.echo(f"[OK] {len(res['divergencias'])} dia(s) divergente(s), {res['corrigidos']} corrigido(s), "
+                   f"{len(res['cadeias_quebradas'])} saldo(s) inconsistente(s).")
+
+    @app.cli.command("processar-folha")
+    @click.option("--mes", required=True, help="Competência YYYY-MM.")
+    @click.option("--estabelecimento", type=int, default=None, help="Só esta loja (padrão: todas).")
+    @click.option("--forcar", is_flag=True, default=False, help="Recalcula todos, mesmo sem mudança.")
+    @with_appcontext
+    def processar_folha(mes, estabelecimento, forcar):
+        """Fecha a folha do mês em lote (snapshot versionado por loja); só
+        recalcula os funcionários cujas entradas mudaram desde a última versão."""
+        from app.models import Estabelecimento, allow_all_tenants
+        from app.services.folha_service import FolhaService
+
+        with allow_all_tenants():
+            ids = [estabelecimento] if estabelecimento else [e.id for e in Estabelecimento.query.all()]
+            for estab_id in ids:
+                proc = FolhaService.processar(estab_id, mes, forcar=forcar)
+                click.echo(f"[OK] loja {estab_id}: v{proc.versao}, {proc.funcionarios} funcionário(s), "
+                           f"{proc.recalculados} recalculado(s).")
+
+    @app.cli.command("verificar-alertas-estoque")
+    @click.option("--sem-notificar", is_flag=True, default=False, help="Só sincroniza, sem enviar e-mails.")
+    @with_appcontext
+    def verificar_alertas_estoque(sem_notificar):
+        """Detecta os alertas de estoque/validade de TODAS as lojas (gravando só
+        as transições) e envia um e-mail-resumo por loja com os alertas novos."""
+        from flask import current_app
+        from app.tasks.estoque_alerts_task import EstoqueAlertsTask
+
+        res = EstoqueAlertsTask.run_daily_checks(current_app._get_current_object(), notificar=not sem_notificar)
+        novos = sum(r["novos"] for r in res["sincronizados"].values())
+        resolvidos = sum(r["resolvidos"] for r in res["sincronizados"].values())
+        click.echo(
+            f"[OK] {novos} alerta(s) novo(s), {resolvidos} resolvido(s), "
+            f"{len(res['notificados'])} loja(s) notificada(s)."
+        )
+
+    @app.cli.command("reconciliar-caixas")
+    @click.option("--corrigir", is_flag=True, default=False, help="Reconstrói os totais divergentes a partir do livro.")
+    @click.option("--todos", is_flag=True, default=False, help="Inclui caixas já fechados (padrão: só os abertos).")
+    @with_appcontext
+    def reconciliar_caixas(corrigir, todos):
+        """Confere os totais correntes (caixa_totais) de cada caixa contra o livro
+        movimentacoes_caixa e lista as divergências."""
+        from app.models import Caixa, allow_all_tenants
+        from app.services.caixa_service import CaixaService
+
+        with allow_all_tenants():
+            q = Caixa.query if todos else Caixa.query.filter_by(status="aberto")
+            ids = [c.id for c in q.with_entities(Caixa.id).all()]
+            divergentes = 0
+            for caixa_id in ids:
+                res = CaixaService.reconciliar(caixa_id, corrigir=corrigir)
+                if not res["consistente"]:
+                    divergentes += 1
+                    click.echo(f"[DIVERGENTE] caixa {caixa_id}: {len(res['divergencias'])} chave(s)"
+                               + (" -> corrigido" if res["corrigido"] else ""))
+        click.echo(f"[OK] {len(ids)} caixa(s) conferido(s), {divergentes} divergente(s).")
+
+    @app.cli.command("reconciliar-financeiro")
+    @click.option("--estabelecimento-id", type=int, default=None, help="Só esta loja (padrão: todas).")
+    @click.option("--meses", type=int, default=2, show_default=True, help="Meses recentes conferidos (corrente incluso).")
+    @click.option("--tudo", is_flag=True, default=False, help="Reconstrói todos os meses com lançamentos.")
+    @with_appcontext
+    def reconciliar_financeiro(estabelecimento_id, meses, tudo):
+        """Confere o razão financeiro mensal contra despesas, contas e vendas e
+        regrava os meses divergentes."""
+        from datetime import timedelta
+        from app.models import Estabelecimento, allow_all_tenants
+        from app.services.financeiro_mensal_service import FinanceiroMensalService, meses_entre
+        from app.utils.timezone import hoje_local
+
+        corrente = hoje_local().replace(day=1)
+        recentes = meses_entre((corrente - timedelta(days=31 * (meses - 1))).replace(day=1), corrente)[-meses:]
+        with allow_all_tenants():
+            ids = [estabelecimento_id] if estabelecimento_id else [
+                e.id for e in Estabelecimento.query.with_entities(Estabelecimento.id).all()]
+            divergentes = 0
+            for estab_id in ids:
+                res = (FinanceiroMensalService.reconciliar_estabelecimento(estab_id) if tudo
+                       else FinanceiroMensalService.reconciliar(estab_id, recentes))
+                if not res["consistente"]:
+                    divergentes += 1
+                    click.echo(f"[DIVERGENTE] estabelecimento {estab_id}: {len(res['divergencias'])} linha(s) -> corrigido")
+        click.echo(f"[OK] {len(ids)} estabelecimento(s) conferido(s), {divergentes} divergente(s).")
+
+    @app.cli.command("bench-login")
+    @click.option("--username", required=True, help="Usuário existente usado nas tentativas.")
+    @click.option("--senha", required=True, help="Senha do usuário.")
+    @click.option("--total", default=100, show_default=True, help="Número de logins.")
+    @click.option("--concorrencia", default=16, show_default=True, help="Logins simultâneos.")
+    @with_appcontext
+    def bench_login(username, senha, total, concorrencia):
+        """Mede a vazão de /api/auth/login sob concorrência (troca de turno).
+
+        Dispara TOTAL logins a partir de CONCORRENCIA threads, cada uma com o
+        seu test client, e reporta logins/s e latências p50/p95/máx."""
+        import statistics
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from flask import current_app
+
+        flask_app = current_app._get_current_object()
+        payload = {"username": username, "senha": senha}
+
+        def _um_login(_):
+            cliente = flask_app.test_client()
+            t0 = time.perf_counter()
+            resp = cliente.post("/api/auth/login", json=payload)
+            return resp.status_code, time.perf_counter() - t0
+
+        # O rate limit de /login (5/min por origem) mediria o limiter, não o login.
+        from app.middleware.rate_limit import limiter
+        limiter_ativo = limiter.enabled
+        limiter.enabled = False
+        try:
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+                resultados = list(executor.map(_um_login, range(total)))
+            duracao = time.perf_counter() - inicio
+        finally:
+            limiter.enabled = limiter_ativo
+
+        latencias = sorted(t for _, t in resultados)
+        ok = sum(1 for status, _ in resultados if status == 200)
+        p95 = latencias[max(0, int(len(latencias) * 0.95) - 1)]
+        click.echo(
+            f"[BENCH] {ok}/{total} OK em {duracao:.2f}s -> {total / duracao:.1f} logins/s "
+            f"(concorrência {concorrencia}) | p50 {statistics.median(latencias) * 1000:.0f} ms "
+            f"| p95 {p95 * 1000:.0f} ms | máx {latencias[-1] * 1000:.0f} ms"
+        )
+
+    @app.cli.command("recalcular-metricas-fornecedores")
+    @click.option("--estabelecimento-id", type=int, default=None, help="Só este estabelecimento (padrão: todos).")
+    @with_appcontext
+    def recalcular_metricas_fornecedores(estabelecimento_id):
+        """Reconstrói o snapshot fornecedores_metricas (após cargas fora do ORM ou migração)."""
+        from app.models import allow_all_tenants
+        from app.services.fornecedor_metricas_service import FornecedorMetricasService
+
+        with allow_all_tenants():
+            if estabelecimento_id:
+                gravadas = {estabelecimento_id: FornecedorMetricasService.recalcular_estabelecimento(estabelecimento_id)}
+            else:
+                gravadas = FornecedorMetricasService.recalcular_todos()
+        click.echo(f"[OK] {sum(gravadas.values())} fornecedor(es) em {len(gravadas)} estabelecimento(s).")
+
+    @app.cli.command("transmitir-contingencia")
+    @click.option("--estabelecimento-id", type=int, default=None, help="Só este estabelecimento (padrão: todos).")
+    @click.option("--limite", type=int, default=200, show_default=True, help="Documentos por rodada.")
+    @click.option("--concorrencia", type=int, default=4, show_default=True, help="Envios simultâneos.")
+    @with_appcontext
+    def transmitir_contingencia(estabelecimento_id, limite, concorrencia):
+        """Transmite os documentos fiscais emitidos em contingência até esvaziar a fila."""
+        from app.models import allow_all_tenants
+        from app.services.fiscal.contingencia import ContingenciaService
+
+        total = 0
+        with allow_all_tenants():
+            ContingenciaService.consultar_pendentes()
+            while True:
+                rodada = ContingenciaService.transmitir(estabelecimento_id, limite, concorrencia)
+                total += rodada["enviados"]
+                click.echo(f"[CONTINGÊNCIA] {rodada['enviados']} enviado(s) em {rodada['duracao_seg']}s: "
+                           f"{rodada['por_status']}")
+                if not rodada["enviados"] or rodada["por_status"].get("contingencia") == rodada["enviados"]:
+                    break
+            ContingenciaService.consultar_pendentes()
+        click.echo(f"[OK] {total} documento(s) transmitido(s).")
+
+    @app.cli.command("reprocessar-emails")
+    @click.option("--id", "ids", type=int, multiple=True, help="Só estes e-mails (padrão: todo o dead-letter).")
+    @with_appcontext
+    def reprocessar_emails(ids):
+        """Devolve à fila os e-mails que esgotaram as tentativas e envia o que estiver pendente."""
+        from app.services.email_fila import EmailFilaService
+
+        devolvidos = EmailFilaService.reenviar_falhos(ids or None)
+        click.echo(f"[EMAIL] {devolvidos} e-mail(s) devolvido(s) à fila.")
+        if not EmailFilaService.ativa():
+            while EmailFilaService.processar_pendentes():
+                pass
+        click.echo(f"[OK] {EmailFilaService.resumo()}")
+
+    @app.cli.command("purgar-emails")
+    @click.option("--dias", type=int, default=None, help="Retenção em dias (padrão: EMAIL_RETENCAO_DIAS).")
+    @with_appcontext
+    def purgar_emails(dias):
+        """Remove e-mails enviados fora da retenção e apaga corpos com senha provisória."""
+        from app.services.email_fila import _RETENCAO_DIAS, EmailFilaService
+
+        click.echo(f"[OK] {EmailFilaService.purgar(dias if dias is not None else _RETENCAO_DIAS)}")
+
+    @app.cli.command("smtp-sink")
+    @click.option("--porta", type=int, default=1025, show_default=True)
+    def smtp_sink(porta):
+        """Servidor SMTP local que só registra as mensagens recebidas (desenvolvimento)."""
+        import time
+        from app.services.smtp_sink import SMTPSink
+
+        with SMTPSink(porta=porta) as sink:
+            click.echo(f"[SMTP] Escutando em 127.0.0.1:{sink.porta} (MAIL_SERVER=127.0.0.1, MAIL_USE_TLS=false). Ctrl+C para sair.")
+            vistas = 0
+            try:
+                while True:
+                    time.sleep(1)
+                    for m in sink.mensagens[vistas:]:
+                        click.echo(f"  {m['remetente']} -> {', '.join(m['destinatarios'])}: {m['assunto']}")
+                    vistas = len(sink.mensagens)
+            except KeyboardInterrupt:
+                pass
+
+    @app.cli.command("particionar-tabelas")
+    @click.option("--tabela", "tabelas", multiple=True,
+                  help="vendas, venda_itens, pagamentos, movimentacoes_estoque (padrão: todas).")
+    @click.option("--meses-a-frente", type=int, default=None, help="Partições futuras criadas já na conversão.")
+    @click.option("--manter-legado", is_flag=True, default=False, help="Não apaga a tabela <tabela>_legado.")
+    @with_appcontext
+    def particionar_tabelas(tabelas, meses_a_frente, manter_legado):
+        """Converte as tabelas de alto volume em particionadas por mês (Postgres).
+        Faça backup antes: PK/UNIQUE passam a incluir a data (código/sync_uuid deixam
+        de ser únicos na tabela toda) e as FKs que apontam para a tabela convertida são
+        removidas; ambas são listadas na saída."""
+        from app.services.particionamento_service import ParticionamentoService
+
+        if not ParticionamentoService.suportado():
+            click.echo("[PARTIÇÕES] Banco atual não é Postgres: nada a fazer.")
+            return
+        for tabela in tabelas or ParticionamentoService.tabelas():
+            res = ParticionamentoService.converter(tabela, meses_a_frente=meses_a_frente, manter_legado=manter_legado)
+            if not res["convertida"]:
+                click.echo(f"[PARTIÇÕES] {tabela}: {res['motivo']}")
+                continue
+            click.echo(f"[OK] {tabela}: {res['linhas']} linha(s) em {res['particoes']} partição(ões) por {res['chave']}.")
+            for fk in res["fks_removidas"]:
+                click.echo(f"  FK removida: {fk}")
+            for nome in res["unicos_com_chave"]:
+                click.echo(f"  Unicidade só por {res['chave']}: {nome}")
+
+    @app.cli.command("manter-particoes")
+    @click.option("--meses-a-frente", type=int, default=None)
+    @with_appcontext
+    def manter_particoes(meses_a_frente):
+        """Cria as partições mensais que faltam até N meses adiante."""
+        from flask import current_app
+        from app.tasks.particoes_task import ParticoesTask
+
+        resumo = ParticoesTask.run(current_app._get_current_object(), meses_a_frente)
+        if not resumo:
+            click.echo("[PARTIÇÕES] Nenhuma tabela particionada.")
+        for tabela, r in resumo.items():
+            click.echo(f"[OK] {tabela}: {len(r['criadas'])} criada(s), {len(r['falhas'])} falha(s).")
+
+    @app.cli.command("arquivar-particoes")
+    @click.option("--antes-de", required=True, help="Mês AAAA-MM: partições anteriores são arquivadas.")
+    @click.option("--esquema", default=None, help="Schema de destino (padrão: PARTICOES_ESQUEMA_ARQUIVO ou 'arquivo').")
+    @click.option("--tabela", "tabelas", multiple=True)
+    @with_appcontext
+    def arquivar_particoes(antes_de, esquema, tabelas):
+        """Desanexa (DETACH) os meses frios e os move para o schema de arquivo."""
+        from datetime import datetime as _dt
+        from app.services.particionamento_service import ParticionamentoService
+
+        try:
+            limite = _dt.strptime(antes_de, "%Y-%m").date()
+        except ValueError:
+            raise click.BadParameter("use o formato AAAA-MM", param_hint="--antes-de")
+        for tabela in tabelas or ParticionamentoService.particionadas():
+            arquivadas = ParticionamentoService.arquivar(tabela, limite, esquema)
+            click.echo(f"[OK] {tabela}: {len(arquivadas)} partição(ões) arquivada(s).")
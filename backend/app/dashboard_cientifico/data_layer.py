@@ -4,13 +4,14 @@ from sqlalchemy import func, desc, extract, case, and_, or_
 from decimal import Decimal, ROUND_HALF_UP
 from app.models import (
     Venda, VendaItem, Produto, Cliente,
-    Funcionario, FuncionarioBeneficio, Beneficio, BancoHoras, RegistroPonto, ConfiguracaoHorario,
-    Despesa, ContaPagar, ContaReceber, JustificativaPonto
+    Funcionario, FuncionarioBeneficio, Beneficio, BancoHoras, RegistroPonto, PontoDiario,
+    Despesa, ContaPagar, ContaReceber, JustificativaPonto, janela_particionada
 )
-from app.utils.query_helpers import _get_db
+from app.utils.query_helpers import _get_db, filtro_periodo
 import logging
 from functools import wraps
 from app.services.rh_calculator_service import calcular_custo_folha_detalhado
+from app.services.ponto_diario_service import PontoDiarioService
 
 logger = logging.getLogger(__name__)
 
@@ -137,7 +138,7 @@ class DataLayer:
                 func.sum(Venda.total).label('valor'),
                 func.count(Venda.id).label('qtd')
             ).filter(
-                func.date(Venda.data_venda) >= start_date,
+                Venda.data_venda >= start_dt,
                 Venda.status == 'finalizada'
             )
             
@@ -151,7 +152,8 @@ class DataLayer:
                 func.date(Venda.data_venda).label('data'),
                 func.sum(VendaItem.custo_unitario * VendaItem.quantidade).label('cogs')
             ).join(VendaItem, Venda.id == VendaItem.venda_id).filter(
-                func.date(Venda.data_venda) >= start_date,
+                Venda.data_venda >= start_dt,
+                *janela_particionada(VendaItem, start_dt),
                 Venda.status == 'finalizada'
             )
             
@@ -165,7 +167,7 @@ class DataLayer:
                 func.date(Despesa.data_despesa).label('data'),
                 func.sum(Despesa.valor).label('valor')
             ).filter(
-                func.date(Despesa.data_despesa) >= start_date
+                filtro_periodo(Despesa.data_despesa, start_date)
             )
             query_despesas = sem_categorias_integradas(query_despesas, Despesa.categoria)
 
@@ -392,6 +394,7 @@ class DataLayer:
              .join(Venda, Venda.id == VendaItem.venda_id)\
              .filter(
                 Venda.data_venda >= start_date,
+                *janela_particionada(VendaItem, start_date),
                 Venda.status == 'finalizada'
             )
             
@@ -443,6 +446,7 @@ class DataLayer:
                 func.sum(VendaItem.total_item).label('total')
             ).join(Venda, Venda.id == VendaItem.venda_id).filter(
                 Venda.data_venda >= start_date,
+                *janela_particionada(VendaItem, start_date),
                 Venda.status == 'finalizada'
             )
             
@@ -522,7 +526,8 @@ class DataLayer:
                 Venda, Venda.id == VendaItem.venda_id
             ).join(
                 Produto, Produto.id == VendaItem.produto_id
-            ).filter(Venda.data_venda >= start_date, Venda.status == 'finalizada')
+            ).filter(Venda.data_venda >= start_date, *janela_particionada(VendaItem, start_date),
+                     Venda.status == 'finalizada')
             vendas_q = _tenant(vendas_q, Venda.estabelecimento_id)
             vendas_por_forn = {
                 r.fid: (float(r.total_faturado or 0), float(r.total_itens or 0))
@@ -699,6 +704,7 @@ class DataLayer:
                 func.sum(VendaItem.quantidade * VendaItem.custo_unitario).label('cogs')
             ).join(VendaItem, VendaItem.venda_id == Venda.id).filter(
                 Venda.data_venda >= start_date,
+                *janela_particionada(VendaItem, start_date),
                 Venda.status == 'finalizada'
             )
             
@@ -748,6 +754,7 @@ class DataLayer:
              .join(Venda, Venda.id == VendaItem.venda_id)\
              .filter(
                 Venda.data_venda >= start_date,
+                *janela_particionada(VendaItem, start_date),
                 Venda.status == 'finalizada'
              )
              
@@ -1029,68 +1036,31 @@ class DataLayer:
             hoje_dia = datetime.now().date()
             inicio_mes = hoje_dia.replace(day=1)
 
-            try:
-                config_query = ConfiguracaoHorario.query
-                if str(estabelecimento_id).lower() != 'all':
-                    config_query = config_query.filter_by(estabelecimento_id=estabelecimento_id)
-                config = config_query.first()
-            except Exception as e:
-                logger.error(f"Erro ao buscar ConfiguracaoHorario (possível falta de migração): {e}")
-                config = None
-
-            hora_saida_ref = config.hora_saida if config and getattr(config, 'hora_saida', None) else datetime.strptime('18:00', '%H:%M').time()
-            tolerancia_saida = int(getattr(config, 'tolerancia_saida', 5) or 5)
-            jornada = int(getattr(config, 'jornada_diaria_minutos', 480) or 480)
-
-            def _time_to_minutes(t):
-                return int(t.hour) * 60 + int(t.minute)
-
-            minuto_saida_ref = _time_to_minutes(hora_saida_ref) + tolerancia_saida
-
-            # Query todos os pontos em lote. O limite inferior cobre tanto a janela
-            # do filtro (days) quanto o mês corrente, pois os blocos "_mes" abaixo
-            # sempre calculam sobre o mês calendário (inicio_mes) — independente do
-            # período selecionado no dashboard.
+            # Assiduidade e horas extras agrupadas no consolidado diário (PontoDiario)
+            # em vez de carregar as batidas do período. O limite inferior cobre tanto
+            # a janela do filtro (days) quanto o mês corrente, pois os blocos "_mes"
+            # abaixo sempre calculam sobre o mês calendário (inicio_mes).
+            estab_ponto = None if str(estabelecimento_id).lower() == 'all' else estabelecimento_id
             data_inicio_pontos = min(data_inicio_dia, inicio_mes)
-            pontos_bulk_query = db.session.query(RegistroPonto).filter(
-                RegistroPonto.data >= data_inicio_pontos
-            )
-            if str(estabelecimento_id).lower() != 'all':
-                pontos_bulk_query = pontos_bulk_query.filter(RegistroPonto.estabelecimento_id == estabelecimento_id)
-            pontos_bulk = pontos_bulk_query.all()
-
-            # 3. Análise de Pontualidade e Assiduidade (Python in-memory)
-            entradas_por_status = {}
-            for p in pontos_bulk:
-                if p.tipo_registro == 'entrada':
-                    status = p.status or 'normal'
-                    if status not in entradas_por_status:
-                        entradas_por_status[status] = []
-                    entradas_por_status[status].append(p)
-
-            total_entradas = sum(len(lst) for lst in entradas_por_status.values())
-            total_atrasos_qtd = len(entradas_por_status.get('atrasado', []))
-            total_minutos_atraso = sum(float(p.minutos_atraso or 0) for status, lst in entradas_por_status.items() for p in lst)
+            totais_ponto = PontoDiarioService.totais(estab_ponto, data_inicio_pontos, hoje_dia)
+
+            # 3. Análise de Pontualidade e Assiduidade
+            total_entradas = totais_ponto["entradas"]
+            total_atrasos_qtd = totais_ponto["entradas_atrasadas"]
+            total_minutos_atraso = totais_ponto["minutos_atraso_entrada"]
             taxa_pontualidade = ((total_entradas - total_atrasos_qtd) / total_entradas * 100) if total_entradas > 0 else 100.0
 
-            # 4. Estimativa de Horas Extras (Python in-memory)
-            minutos_extras_estimados = 0
-            overtime_by_employee = {}
-            overtime_by_day = {}
-            saidas_periodo = [p for p in pontos_bulk if p.tipo_registro == 'saida']
-
-            for p in saidas_periodo:
-                if not p.hora:
-                    continue
-                minutos_saida = _time_to_minutes(p.hora)
-                extra = minutos_saida - minuto_saida_ref
-                if extra <= 0:
-                    continue
-                minutos_extras_estimados += extra
-                overtime_by_employee[p.funcionario_id] = overtime_by_employee.get(p.funcionario_id, 0) + extra
-                day_key = p.data.isoformat() if p.data else None
-                if day_key:
-                    overtime_by_day[day_key] = overtime_by_day.get(day_key, 0) + extra
+            # 4. Horas Extras (além da jornada diária, mesma regra do espelho)
+            minutos_extras_estimados = totais_ponto["minutos_extras"]
+            overtime_by_employee = {
+                fid: t["minutos_extras"]
+                for fid, t in PontoDiarioService.resumo_por_funcionario(estab_ponto, data_inicio_pontos, hoje_dia).items()
+                if t["minutos_extras"] > 0
+            }
+            overtime_by_day = {
+                dia.isoformat(): t["minutos_extras"]
+                for dia, t in PontoDiarioService.serie_diaria(estab_ponto, hoje_dia - timedelta(days=13), hoje_dia).items()
+            }
 
             # Buscamos a query dos benefícios por funcionário primeiro para evitar queries duplicadas
             query_ben_func = db.session.query(
@@ -1197,21 +1167,21 @@ class DataLayer:
             
             demissoes_map = {(int(r.ano), int(r.mes)): r.qtd for r in demissoes_bulk}
             
-            # Busca todos os atrasos do ano agrupados por mês
+            # Busca todos os atrasos do ano agrupados por mês (consolidado diário)
             atrasos_bulk_query = db.session.query(
-                extract('year', RegistroPonto.data).label('ano'),
-                extract('month', RegistroPonto.data).label('mes'),
-                func.count(RegistroPonto.id).label('qtd')
+                extract('year', PontoDiario.data).label('ano'),
+                extract('month', PontoDiario.data).label('mes'),
+                func.coalesce(func.sum(PontoDiario.batidas_atrasadas), 0).label('qtd')
             ).filter(
-                RegistroPonto.data >= start_history,
-                RegistroPonto.minutos_atraso > 0
+                PontoDiario.data >= start_history,
+                PontoDiario.batidas_atrasadas > 0
             )
             if str(estabelecimento_id).lower() != 'all':
-                atrasos_bulk_query = atrasos_bulk_query.filter(RegistroPonto.estabelecimento_id == estabelecimento_id)
+                atrasos_bulk_query = atrasos_bulk_query.filter(PontoDiario.estabelecimento_id == estabelecimento_id)
             
             atrasos_bulk = atrasos_bulk_query.group_by('ano', 'mes').all()
             
-            atrasos_map = {(int(r.ano), int(r.mes)): r.qtd for r in atrasos_bulk}
+            atrasos_map = {(int(r.ano), int(r.mes)): int(r.qtd or 0) for r in atrasos_bulk}
 
             evolution_turnover = []
             meses_nomes = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
@@ -1269,30 +1239,16 @@ class DataLayer:
                             "custo_estimado": round((float(mins) / 60) * valor_hora_medio * 1.5, 2)
                         })
 
-            # 12. Entradas Atrasadas no Mês (Python in-memory de pontos_bulk)
-            atrasos_por_func_id = {}
-            for p in pontos_bulk:
-                if p.data >= inicio_mes and p.tipo_registro == 'entrada' and p.minutos_atraso and int(p.minutos_atraso) > 0:
-                    fid = p.funcionario_id
-                    if fid not in atrasos_por_func_id:
-                        atrasos_por_func_id[fid] = {"qtd": 0, "minutos": 0}
-                    atrasos_por_func_id[fid]["qtd"] += 1
-                    atrasos_por_func_id[fid]["minutos"] += int(p.minutos_atraso or 0)
-
-            # 13. Saídas no Mês (Python in-memory de pontos_bulk)
-            extras_mes_por_func_id: Dict[int, int] = {}
-            extras_mes_por_dia: Dict[str, int] = {}
-            for p in pontos_bulk:
-                if p.data >= inicio_mes and p.tipo_registro == 'saida':
-                    if not p.hora:
-                        continue
-                    minutos_saida = _time_to_minutes(p.hora)
-                    extra = minutos_saida - minuto_saida_ref
-                    if extra <= 0:
-                        continue
-                    extras_mes_por_func_id[p.funcionario_id] = extras_mes_por_func_id.get(p.funcionario_id, 0) + int(extra)
-                    if p.data:
-                        extras_mes_por_dia[p.data.isoformat()] = extras_mes_por_dia.get(p.data.isoformat(), 0) + int(extra)
+            # 12/13/15. Atrasos de entrada, horas extras e dias com entrada no mês:
+            # um GROUP BY funcionario_id no consolidado diário
+            ponto_mes = PontoDiarioService.resumo_por_funcionario(estab_ponto, inicio_mes, hoje_dia)
+            atrasos_por_func_id = {
+                fid: {"qtd": t["entradas_com_atraso"], "minutos": t["minutos_atraso_entrada"]}
+                for fid, t in ponto_mes.items() if t["entradas_com_atraso"]
+            }
+            extras_mes_por_func_id: Dict[int, int] = {
+                fid: t["minutos_extras"] for fid, t in ponto_mes.items() if t["minutos_extras"]
+            }
 
             # Organizar detalhes de benefícios (já populados de beneficios_por_func)
             beneficios_por_func_id = {}
@@ -1315,18 +1271,7 @@ class DataLayer:
                     dias_uteis_mes += 1
                 d += timedelta(days=1)
 
-            # 15. Dias com Entrada no Mês (Python in-memory de pontos_bulk)
-            dias_com_entrada_mes_por_id = {}
-            dias_entrada_func_dates = {}  # funcionario_id -> set of dates
-            for p in pontos_bulk:
-                if p.data >= inicio_mes and p.tipo_registro == 'entrada':
-                    fid = p.funcionario_id
-                    if fid not in dias_entrada_func_dates:
-                        dias_entrada_func_dates[fid] = set()
-                    dias_entrada_func_dates[fid].add(p.data)
-            
-            for fid, dates in dias_entrada_func_dates.items():
-                dias_com_entrada_mes_por_id[fid] = len(dates)
+            dias_com_entrada_mes_por_id = {fid: t["dias_presentes"] for fid, t in ponto_mes.items()}
 
             banco_horas_registros_query = db.session.query(BancoHoras).join(Funcionario).filter(
                 BancoHoras.mes_referencia == banco_horas_mes
@@ -1500,58 +1445,30 @@ class DataLayer:
 
             start_daily = hoje_dia - timedelta(days=6)
             pontos_query = db.session.query(
-                RegistroPonto.funcionario_id,
                 Funcionario.nome,
-                RegistroPonto.data,
-                RegistroPonto.hora,
-                RegistroPonto.tipo_registro,
-                RegistroPonto.minutos_atraso
-            ).join(Funcionario).filter(
-                RegistroPonto.data >= start_daily
+                PontoDiario.data,
+                PontoDiario.primeira_entrada,
+                PontoDiario.ultima_saida,
+                PontoDiario.minutos_atraso_entrada,
+                PontoDiario.minutos_extras
+            ).join(Funcionario, Funcionario.id == PontoDiario.funcionario_id).filter(
+                PontoDiario.data >= start_daily
             )
             
             if str(estabelecimento_id).lower() != 'all':
-                pontos_query = pontos_query.filter(RegistroPonto.estabelecimento_id == estabelecimento_id)
-                
-            pontos = pontos_query.all()
-
-            daily_map: Dict[str, Dict[str, Any]] = {}
-            for func_id, nome, data_p, hora_p, tipo, min_atraso in pontos:
-                if not data_p:
-                    continue
-                key = f"{data_p.isoformat()}:{func_id}"
-                if key not in daily_map:
-                    daily_map[key] = {
-                        "data": data_p.isoformat(),
-                        "funcionario": nome,
-                        "entrada": None,
-                        "saida": None,
-                        "minutos_atraso": 0,
-                        "minutos_extras": 0
-                    }
-                row = daily_map[key]
-                if tipo == "entrada" and hora_p:
-                    if row["entrada"] is None or hora_p < row["entrada"]:
-                        row["entrada"] = hora_p
-                    row["minutos_atraso"] += int(min_atraso or 0)
-                if tipo == "saida" and hora_p:
-                    if row["saida"] is None or hora_p > row["saida"]:
-                        row["saida"] = hora_p
-
-            daily_summary = []
-            for row in daily_map.values():
-                saida = row["saida"]
-                if saida:
-                    extra = _time_to_minutes(saida) - minuto_saida_ref
-                    row["minutos_extras"] = int(extra) if extra > 0 else 0
-                daily_summary.append({
-                    "data": row["data"],
-                    "funcionario": row["funcionario"],
-                    "entrada": row["entrada"].strftime("%H:%M") if row["entrada"] else "-",
-                    "saida": row["saida"].strftime("%H:%M") if row["saida"] else "-",
-                    "minutos_atraso": int(row["minutos_atraso"]),
-                    "minutos_extras": int(row["minutos_extras"])
-                })
+                pontos_query = pontos_query.filter(PontoDiario.estabelecimento_id == estabelecimento_id)
+
+            daily_summary = [
+                {
+                    "data": data_p.isoformat(),
+                    "funcionario": nome,
+                    "entrada": entrada.strftime("%H:%M") if entrada else "-",
+                    "saida": saida.strftime("%H:%M") if saida else "-",
+                    "minutos_atraso": int(atraso or 0),
+                    "minutos_extras": int(extras or 0)
+                }
+                for nome, data_p, entrada, saida, atraso, extras in pontos_query.all()
+            ]
 
             daily_summary.sort(key=lambda r: (r["data"], r["funcionario"]), reverse=True)
 
@@ -1699,6 +1616,7 @@ class DataLayer:
             ).join(Venda).filter(
                 Venda.data_venda >= start_dt,
                 Venda.data_venda <= end_dt,
+                *janela_particionada(Pagamento, start_dt),
                 Venda.status != 'cancelada',
                 Pagamento.status == 'aprovado'
             )
@@ -1777,6 +1695,7 @@ class DataLayer:
             ).filter(
                 Venda.data_venda >= start_dt,
                 Venda.data_venda <= end_dt,
+                *janela_particionada(VendaItem, start_dt),
                 Venda.status != 'cancelada'
             )
             if estabelecimento_id != 'all': q_cogs = q_cogs.filter(Venda.estabelecimento_id == estabelecimento_id)
@@ -1798,10 +1717,15 @@ class DataLayer:
             return {"revenue": 0.0, "cogs": 0.0, "gross_profit": 0.0, "count": 0}
     @staticmethod
     @provide_session
-    def get_consolidated_financial_summary(db, estabelecimento_id: int, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
+    def get_consolidated_financial_summary(db, estabelecimento_id: int, start_date: datetime, end_date: datetime,
+                                           razao=None) -> Dict[str, Any]:
         """
         Consolida dados financeiros para o Resumo Financeiro (DRE + Fluxo).
         Otimizado para reduzir round-trips ao banco.
+
+        razao: RazaoMensal (FinanceiroMensalService.ler) dos meses inteiros do
+        período — vendas, despesas e boletos pagos saem dele em vez de agregar
+        as tabelas; saldos em aberto e caixa do PDV continuam ao vivo.
         """
         # Estrutura padrão para evitar 500 se algo falhar
         result = {
@@ -1831,19 +1755,22 @@ class DataLayer:
 
             # 1. DADOS DE VENDAS
             try:
-                sales_data = DataLayer.get_sales_financials(estabelecimento_id, start_dt, end_dt)
-                if isinstance(sales_data, dict):
-                    result["vendas"].update(sales_data)
-                
-                # Adicionar total recebido (Cash Flow)
-                q_total_rec = db.session.query(func.sum(Venda.valor_recebido)).filter(
-                    Venda.data_venda >= start_dt,
-                    Venda.data_venda <= end_dt,
-                    Venda.status != 'cancelada'
-                )
-                if estabelecimento_id != 'all': q_total_rec = q_total_rec.filter(Venda.estabelecimento_id == estabelecimento_id)
-                total_recebido = q_total_rec.scalar() or 0.0
-                result["vendas"]["total_recebido"] = float(total_recebido)
+                if razao is not None:
+                    result["vendas"].update(razao.vendas())
+                else:
+                    sales_data = DataLayer.get_sales_financials(estabelecimento_id, start_dt, end_dt)
+                    if isinstance(sales_data, dict):
+                        result["vendas"].update(sales_data)
+
+                    # Adicionar total recebido (Cash Flow)
+                    q_total_rec = db.session.query(func.sum(Venda.valor_recebido)).filter(
+                        Venda.data_venda >= start_dt,
+                        Venda.data_venda <= end_dt,
+                        Venda.status != 'cancelada'
+                    )
+                    if estabelecimento_id != 'all': q_total_rec = q_total_rec.filter(Venda.estabelecimento_id == estabelecimento_id)
+                    total_recebido = q_total_rec.scalar() or 0.0
+                    result["vendas"]["total_recebido"] = float(total_recebido)
 
                 # ── MovimentacaoCaixa do PDV (sangrias e suprimentos) ─────────
                 try:
@@ -1883,31 +1810,44 @@ class DataLayer:
                 _sem_espelho_boleto = _cat_norm.notin_(_CATS_ESPELHO_BOLETO)
                 _sem_espelho_total = _cat_norm.notin_(_CATS_INTEGRADAS)
 
-                q_desp = db.session.query(
-                    func.sum(case((_sem_espelho_total, Despesa.valor), else_=0)).label('operacionais'),
-                    func.sum(case((and_(_sem_espelho_total, Despesa.recorrente == True), Despesa.valor), else_=0)).label('recorrentes'),
-                    # Visão CAIXA: tudo que saiu como Despesa exceto os espelhos
-                    # de boleto (cobertos por ContaPagar.pago_periodo) — inclui
-                    # pagamentos manuais de salário, que SÃO desembolso real.
-                    func.sum(case((_sem_espelho_boleto, Despesa.valor), else_=0)).label('caixa'),
-                ).filter(
-                    Despesa.data_despesa >= start_dt,
-                    Despesa.data_despesa <= end_dt
-                )
-                if estabelecimento_id != 'all': q_desp = q_desp.filter(Despesa.estabelecimento_id == estabelecimento_id)
-                despesas_query = q_desp.first()
+                if razao is not None:
+                    despesas_razao = razao.despesas()
+                    total_despesas_operacionais = despesas_razao["despesas_operacionais"]
+                    total_recorrentes = despesas_razao["recorrentes"]
+                    despesas_caixa = despesas_razao["despesas_caixa"]
+                    try:
+                        from app.services.financeiro_mensal_service import FinanceiroMensalService
+                        despesas_pessoal = float(FinanceiroMensalService.custo_folha(
+                            estabelecimento_id, start_dt.date(), end_dt.date()))
+                    except Exception as e_folha:
+                        logger.error(f"Erro calculando folha no DRE: {e_folha}")
+                        despesas_pessoal = 0.0
+                else:
+                    q_desp = db.session.query(
+                        func.sum(case((_sem_espelho_total, Despesa.valor), else_=0)).label('operacionais'),
+                        func.sum(case((and_(_sem_espelho_total, Despesa.recorrente == True), Despesa.valor), else_=0)).label('recorrentes'),
+                        # Visão CAIXA: tudo que saiu como Despesa exceto os espelhos
+                        # de boleto (cobertos por ContaPagar.pago_periodo) — inclui
+                        # pagamentos manuais de salário, que SÃO desembolso real.
+                        func.sum(case((_sem_espelho_boleto, Despesa.valor), else_=0)).label('caixa'),
+                    ).filter(
+                        Despesa.data_despesa >= start_dt,
+                        Despesa.data_despesa <= end_dt
+                    )
+                    if estabelecimento_id != 'all': q_desp = q_desp.filter(Despesa.estabelecimento_id == estabelecimento_id)
+                    despesas_query = q_desp.first()
 
-                # Buscar o custo da folha de pagamento e somá-lo
-                try:
-                    folha_dados = calcular_custo_folha_detalhado(estabelecimento_id, start_dt, end_dt)
-                    despesas_pessoal = float(folha_dados.get("custo_folha", {}).get("custo_real_total", 0.0))
-                except Exception as e_folha:
-                    logger.error(f"Erro calculando folha no DRE: {e_folha}")
-                    despesas_pessoal = 0.0
+                    # Buscar o custo da folha de pagamento e somá-lo
+                    try:
+                        folha_dados = calcular_custo_folha_detalhado(estabelecimento_id, start_dt, end_dt)
+                        despesas_pessoal = float(folha_dados.get("custo_folha", {}).get("custo_real_total", 0.0))
+                    except Exception as e_folha:
+                        logger.error(f"Erro calculando folha no DRE: {e_folha}")
+                        despesas_pessoal = 0.0
 
-                total_despesas_operacionais = float(despesas_query.operacionais or 0) if despesas_query else 0.0
-                total_recorrentes = float(despesas_query.recorrentes or 0) if despesas_query else 0.0
-                despesas_caixa = float(despesas_query.caixa or 0) if despesas_query else 0.0
+                    total_despesas_operacionais = float(despesas_query.operacionais or 0) if despesas_query else 0.0
+                    total_recorrentes = float(despesas_query.recorrentes or 0) if despesas_query else 0.0
+                    despesas_caixa = float(despesas_query.caixa or 0) if despesas_query else 0.0
 
                 result["despesas"] = {
                     "total": total_despesas_operacionais + despesas_pessoal,
@@ -1943,13 +1883,17 @@ class DataLayer:
                 contas_query = q_contas.first()
                 
                 # Pagamentos realizados no período específico (para Fluxo de Caixa REAL)
-                q_pagamentos = db.session.query(func.coalesce(func.sum(ContaPagar.valor_pago), 0)).filter(
-                    ContaPagar.data_pagamento >= start_dt,
-                    ContaPagar.data_pagamento <= end_dt,
-                    ContaPagar.status.in_(['pago', 'parcial'])
-                )
-                if estabelecimento_id != 'all': q_pagamentos = q_pagamentos.filter(ContaPagar.estabelecimento_id == estabelecimento_id)
-                pagamentos_query = q_pagamentos.scalar()
+                if razao is not None:
+                    from app.services.financeiro_mensal_service import PAGAR_PAGO
+                    pagamentos_query = razao.valor(PAGAR_PAGO)
+                else:
+                    q_pagamentos = db.session.query(func.coalesce(func.sum(ContaPagar.valor_pago), 0)).filter(
+                        ContaPagar.data_pagamento >= start_dt,
+                        ContaPagar.data_pagamento <= end_dt,
+                        ContaPagar.status.in_(['pago', 'parcial'])
+                    )
+                    if estabelecimento_id != 'all': q_pagamentos = q_pagamentos.filter(ContaPagar.estabelecimento_id == estabelecimento_id)
+                    pagamentos_query = q_pagamentos.scalar()
 
                 result["contas_pagar"] = {
                     "total_aberto": float(contas_query.total_aberto),
@@ -15,7 +15,7 @@ from flask import g, has_app_context, has_request_context, current_app
 from flask_login import LoginManager, UserMixin
 from flask_sqlalchemy import SQLAlchemy
 from flask_sqlalchemy.query import Query as _BaseQuery
-from sqlalchemy import MetaData, case, event, func, or_
+from sqlalchemy import MetaData, case, event, func, inspect, or_
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import declared_attr, validates
 from werkzeug.security import check_password_hash, generate_password_hash
@@ -221,6 +221,31 @@ def validar_cnpj(cnpj: str) -> bool:
 def is_offline_mode() -> bool:
     return os.environ.get("MERCADINHO_OFFLINE", "false").lower() == "true"
 
+# Itens e pagamentos são gravados junto (ou depois) da venda; a folga cobre
+# venda com data_venda retroativa/fuso diferente do created_at dos filhos.
+FOLGA_PARTICAO_FILHA = timedelta(days=1)
+
+def janela_particionada(modelo, inicio, fim=None) -> list:
+    """Predicados na chave de partição mensal de ``modelo`` (``__chave_particao__``).
+
+    Somados a um filtro de período em data_venda, deixam o Postgres podar as
+    partições de venda_itens/pagamentos que não podem ter linhas da janela
+    (ver ParticionamentoService). Em tabela filha só há limite inferior, com
+    folga: o created_at do filho nunca é anterior à venda. No SQLite (sem
+    particionamento nativo) o predicado só usa o índice em created_at.
+    """
+    if inicio is None:
+        return []
+    coluna = getattr(modelo, modelo.__chave_particao__)
+    if isinstance(inicio, date) and not isinstance(inicio, datetime):
+        inicio = datetime.combine(inicio, datetime.min.time())
+    if getattr(modelo, "__particao_filha__", False):
+        return [coluna >= inicio - FOLGA_PARTICAO_FILHA]
+    predicados = [coluna >= inicio]
+    if fim is not None:
+        predicados.append(coluna <= fim)
+    return predicados
+
 # ------------------------------------------------------------------------------
 # Mixins (Clean Code)
 # ------------------------------------------------------------------------------
@@ -532,6 +557,7 @@ class Funcionario(db.Model, MultiTenantMixin, UserMixin, SoftDeleteMixin, Serial
     username = db.Column(db.String(50), nullable=False)
     senha = db.Column(db.String(255), nullable=False)
     pin_cancelamento = db.Column(db.String(255))  # Hash do PIN numérico (4 a 6 dígitos) para cancelamentos/estornos
+    pin_busca = db.Column(db.String(80))  # HMAC com pepper do PIN (pin_service): acha o autorizador pelo índice
     foto_url = db.Column(db.String(500))
     role = db.Column(db.String(30), default="FUNCIONARIO")
     # nivel_acesso: 1=Admin, 2=Gerente, 3=RH, 4=Estoque/Caixa, 5=Vendedor, 6=Entregador
@@ -547,6 +573,7 @@ class Funcionario(db.Model, MultiTenantMixin, UserMixin, SoftDeleteMixin, Serial
         db.Index("ix_funcionario_estabelecimento", "estabelecimento_id"),
         db.UniqueConstraint("estabelecimento_id", "cpf", name="uq_funcionario_estab_cpf"),
         db.UniqueConstraint("estabelecimento_id", "username", name="uq_funcionario_estab_username"),
+        db.Index("ix_funcionario_pin_busca", "estabelecimento_id", "pin_busca"),
     )
 
     @validates("cpf")
@@ -573,11 +600,14 @@ class Funcionario(db.Model, MultiTenantMixin, UserMixin, SoftDeleteMixin, Serial
         """Define o PIN de cancelamento/estorno (4 a 6 dígitos numéricos), armazenado com hash."""
         pin = str(pin or "").strip()
         if not pin:
-            self.pin_cancelamento = None
+            self.pin_cancelamento = self.pin_busca = None
             return
         if not (pin.isdigit() and 4 <= len(pin) <= 6):
             raise ValueError("PIN deve conter de 4 a 6 dígitos numéricos")
+        from app.services.pin_service import chave_busca
         self.pin_cancelamento = generate_password_hash(pin)
+        # Sem tenant ainda (cadastro em andamento) fica sem chave: migra no primeiro uso
+        self.pin_busca = chave_busca(self.estabelecimento_id, pin) if self.estabelecimento_id else None
 
     def check_pin(self, pin):
         """Valida o PIN informado contra o hash armazenado."""
@@ -598,6 +628,7 @@ class Funcionario(db.Model, MultiTenantMixin, UserMixin, SoftDeleteMixin, Serial
         data.pop("password_hash", None)
         # Nunca expor o hash do PIN; expor apenas se está configurado
         data.pop("pin_cancelamento", None)
+        data.pop("pin_busca", None)
         data["tem_pin"] = self.tem_pin
         data["usuario"] = self.username
         # Compat: telas antigas leem "nivel_acesso" como string do cargo.
@@ -667,6 +698,43 @@ class BancoHoras(db.Model, MultiTenantMixin):
     __table_args__ = (db.UniqueConstraint("funcionario_id", "mes_referencia", name="uq_banco_func_mes"),)
 
 
+class BancoHorasLancamento(db.Model, MultiTenantMixin):
+    """Razão (ledger) do banco de horas: só recebe INSERT.
+
+    Cada recálculo de um dia do funcionário (batida, ajuste, exclusão,
+    justificativa respondida, reconciliação) que muda o valor do dia grava um
+    lançamento com o delta e o saldo corrido após ele; ``sequencia`` é a ordem
+    por funcionário. O saldo atual (ou em qualquer instante) é a leitura do
+    último lançamento pelo índice, sem somar o histórico. BancoHoras (mensal)
+    é o resumo mutável mantido junto. Mantido pelo banco_horas_service."""
+    __tablename__ = "banco_horas_lancamentos"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    funcionario_id = db.Column(db.Integer, db.ForeignKey("funcionarios.id", ondelete="CASCADE"), nullable=False)
+    sequencia = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.Date, nullable=False)  # dia a que o lançamento se refere
+    origem = db.Column(db.String(20), nullable=False)  # ponto | justificativa | reconciliacao
+    referencia_id = db.Column(db.Integer)  # RegistroPonto/JustificativaPonto que motivou, quando houver
+    minutos_trabalhados = db.Column(db.Integer, nullable=False, default=0)  # estado do dia após o lançamento
+    minutos_esperados = db.Column(db.Integer, nullable=False, default=0)
+    valor_dia = db.Column(db.Integer, nullable=False, default=0)  # saldo do dia (trabalhado - esperado)
+    delta_minutos = db.Column(db.Integer, nullable=False)
+    saldo_minutos = db.Column(db.Integer, nullable=False)  # saldo corrido do funcionário
+    criado_em = db.Column(db.DateTime, nullable=False, default=utcnow)
+    __table_args__ = (
+        db.UniqueConstraint("funcionario_id", "sequencia", name="uq_banco_lanc_func_seq"),
+        db.Index("ix_banco_lanc_func_data", "funcionario_id", "data", "sequencia"),
+        db.Index("ix_banco_lanc_func_criado", "funcionario_id", "criado_em"),
+    )
+
+
+@event.listens_for(BancoHorasLancamento, "before_update")
+@event.listens_for(BancoHorasLancamento, "before_delete")
+def _banco_horas_somente_insercao(mapper, connection, target):
+    raise ValueError("Lançamentos do banco de horas não são alterados: grave um lançamento de reconciliação")
+
+
+
 class EspelhoAssinatura(db.Model, MultiTenantMixin):
     """Confirmação do funcionário de que conferiu seu espelho de ponto do período
     (Regra de Acesso: todo funcionário deve poder assinar seu próprio espelho)."""
@@ -732,6 +800,62 @@ class ProvisaoTrabalhista(db.Model, MultiTenantMixin, AuditMixin, SerializableMi
         return data
 
 
+class FolhaProcessamento(db.Model, MultiTenantMixin, SerializableMixin):
+    """Processamento da folha de um mês (competência) para a loja inteira.
+
+    Snapshot imutável: cada processamento grava uma versão nova com uma linha
+    por funcionário (FolhaProcessamentoItem); reprocessar o mês cria a versão
+    seguinte, reaproveitando as linhas cujas entradas não mudaram. Holerite,
+    provisões e retrospectiva do mês são servidos da versão mais recente."""
+    __tablename__ = "folha_processamentos"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    mes_referencia = db.Column(db.String(7), nullable=False)  # 'YYYY-MM'
+    versao = db.Column(db.Integer, nullable=False, default=1)
+    criado_por_id = db.Column(db.Integer, db.ForeignKey("funcionarios.id", ondelete="SET NULL"), nullable=True)
+    criado_em = db.Column(db.DateTime, default=utcnow)
+    funcionarios = db.Column(db.Integer, nullable=False, default=0)
+    recalculados = db.Column(db.Integer, nullable=False, default=0)  # os demais vieram da versão anterior
+    total_vencimentos = db.Column(db.Numeric(19, 4), default=0)
+    total_descontos = db.Column(db.Numeric(19, 4), default=0)
+    total_liquido = db.Column(db.Numeric(19, 4), default=0)
+    total_custo_real = db.Column(db.Numeric(19, 4), default=0)
+    itens = db.relationship("FolhaProcessamentoItem", backref="processamento", lazy="dynamic",
+                            cascade="all, delete-orphan", passive_deletes=True)
+    __table_args__ = (
+        db.UniqueConstraint("estabelecimento_id", "mes_referencia", "versao", name="uq_folha_proc_estab_mes_versao"),
+    )
+
+
+class FolhaProcessamentoItem(db.Model, MultiTenantMixin):
+    """Linha de um funcionário num processamento: holerite, provisões e
+    retrospectiva já calculados, mais a assinatura (hash) das entradas usadas
+    — é ela que decide se a linha é reaproveitada no reprocessamento."""
+    __tablename__ = "folha_processamento_itens"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    processamento_id = db.Column(db.Integer, db.ForeignKey("folha_processamentos.id", ondelete="CASCADE"),
+                                 nullable=False, index=True)
+    funcionario_id = db.Column(db.Integer, db.ForeignKey("funcionarios.id", ondelete="CASCADE"), nullable=False)
+    assinatura = db.Column(db.String(64), nullable=False)
+    recalculado = db.Column(db.Boolean, nullable=False, default=True)
+    liquido = db.Column(db.Numeric(19, 4), default=0)
+    custo_real = db.Column(db.Numeric(19, 4), default=0)
+    holerite_json = db.Column(db.JSON, nullable=False)
+    provisoes_json = db.Column(db.JSON, nullable=False)
+    retrospectiva_json = db.Column(db.JSON, nullable=False)
+    __table_args__ = (
+        db.UniqueConstraint("processamento_id", "funcionario_id", name="uq_folha_item_proc_func"),
+        db.Index("ix_folha_item_funcionario", "funcionario_id"),
+    )
+
+
+@event.listens_for(FolhaProcessamento, "before_update")
+@event.listens_for(FolhaProcessamentoItem, "before_update")
+def _folha_processada_imutavel(mapper, connection, target):
+    raise ValueError("Processamento de folha é imutável: reprocesse o mês para gerar uma nova versão")
+
+
 # Defaults CLT (tabelas 2024/2025) — editáveis por tenant via ConfiguracaoFolha
 INSS_FAIXAS_PADRAO = [
     {"ate": 1412.00, "aliquota": 7.5},
@@ -849,134 +973,45 @@ class Cliente(db.Model, MultiTenantMixin, SoftDeleteMixin, SerializableMixin, Au
 
     @classmethod
     def calcular_rfm(cls, estabelecimento_id, days: int = 180) -> Dict[str, Any]:
-        from sqlalchemy import text
-        from datetime import datetime, timezone
-
-        estab_filter = ""
-        venda_estab_filter = ""
-        params = {}
-        if str(estabelecimento_id).lower() != 'all':
-            estab_filter = "AND c.estabelecimento_id = :estab_id"
-            venda_estab_filter = "AND v.estabelecimento_id = :estab_id"
-            params["estab_id"] = estabelecimento_id
-
-        engine_name = str(db.engine.name).lower()
-        if 'sqlite' in engine_name:
-            dow_expr = "CAST(strftime('%w', v.data_venda) AS INTEGER)"
-        else:
-            dow_expr = "EXTRACT(DOW FROM v.data_venda)"
-
-        # Query principal de inteligência (sem limite de 180 dias fixo, varre base ativa com compras)
-        sql = f"""
-        SELECT 
-            c.id as cliente_id,
-            c.nome,
-            c.total_compras,
-            c.valor_total_gasto,
-            c.ultima_compra,
-            c.saldo_devedor,
-            c.score_credito,
-            SUM(CASE WHEN {dow_expr} IN (0, 6) THEN 1 ELSE 0 END) as vendas_fds,
-            SUM(CASE WHEN v.desconto > 0 THEN 1 ELSE 0 END) as vendas_promo
-        FROM clientes c
-        LEFT JOIN vendas v ON v.cliente_id = c.id AND v.status = 'finalizada' {venda_estab_filter}
-        WHERE c.ativo = true AND c.deleted_at IS NULL AND c.total_compras > 0
-        {estab_filter}
-        GROUP BY c.id, c.nome, c.total_compras, c.valor_total_gasto, c.ultima_compra, c.saldo_devedor, c.score_credito
-        """
-        
-        rows = db.session.execute(text(sql), params).fetchall()
-        now = datetime.now(timezone.utc).replace(tzinfo=None)
-        
-        metrics = []
-        for r in rows:
-            ultima = r.ultima_compra
-            recency_days = (now - ultima).days if ultima else 999
-            ticket_medio = float(r.valor_total_gasto) / int(r.total_compras) if r.total_compras else 0
-            metrics.append({
-                "cliente_id": r.cliente_id,
-                "nome": r.nome,
-                "recency_days": int(recency_days),
-                "frequency": int(r.total_compras),
-                "monetary": float(r.valor_total_gasto),
-                "ticket_medio": ticket_medio,
-                "saldo_devedor": float(r.saldo_devedor or 0),
-                "score_credito": int(r.score_credito or 500),
-                "vendas_fds": int(r.vendas_fds or 0),
-                "vendas_promo": int(r.vendas_promo or 0)
-            })
-
-        if not metrics:
-            return {"segments": {}, "customers": [], "consumidor_final": {}, "window_days": days}
-
-        frequency_sorted = sorted(m["frequency"] for m in metrics)
-        ticket_sorted = sorted(m["ticket_medio"] for m in metrics)
-
-        # Limiares 75%
-        freq_alta = frequency_sorted[int(len(frequency_sorted) * 0.75)] if len(frequency_sorted) > 3 else 3
-        ticket_alto = ticket_sorted[int(len(ticket_sorted) * 0.75)] if len(ticket_sorted) > 3 else 100
-
-        segments_count = {
-            "VIP": 0, "Premium": 0, "Final de Semana": 0, 
-            "Caçador de Promoções": 0, "Novo": 0, "Raro": 0, "Regular": 0
-        }
-        customers = []
-
-        for m in metrics:
-            f = m["frequency"]
-            tm = m["ticket_medio"]
-            r_days = m["recency_days"]
-            fds = m["vendas_fds"]
-            promo = m["vendas_promo"]
-
-            seg = "Regular"
-            if f == 1: seg = "Novo"
-            elif r_days > 90 and f < freq_alta: seg = "Raro"
-            elif f >= freq_alta and tm >= ticket_alto: seg = "VIP"
-            elif f >= freq_alta or tm >= ticket_alto: seg = "Premium"
-            elif fds > (f * 0.5): seg = "Final de Semana"
-            elif promo > (f * 0.5): seg = "Caçador de Promoções"
-
-            segments_count[seg] += 1
-            
-            risco = "BAIXO"
-            if m["saldo_devedor"] > 0:
-                if m["score_credito"] < 300: risco = "ALTO"
-                elif m["score_credito"] < 700: risco = "MEDIO"
-
-            bom_pagador = m["saldo_devedor"] == 0 or m["score_credito"] >= 700
-            sugestao_limite = round(tm * f * 0.3, 2) if m["score_credito"] >= 600 else 0
-
-            customers.append({
-                **m,
-                "segment": seg,
-                "risco_inadimplencia": risco,
-                "bom_pagador": bom_pagador,
-                "sugestao_limite": sugestao_limite
-            })
-
-        cf_sql = f"""
-        SELECT 
-            COUNT(*) as total_vendas,
-            SUM(CASE WHEN cliente_id IS NULL THEN 1 ELSE 0 END) as cf_vendas,
-            SUM(CASE WHEN cliente_id IS NULL THEN total ELSE 0 END) as cf_valor
-        FROM vendas
-        WHERE status = 'finalizada'
-        {estab_filter.replace('c.estabelecimento_id', 'estabelecimento_id')}
-        """
-        cf_row = db.session.execute(text(cf_sql), params).fetchone()
-        
-        consumidor_final = {
-            "percentual_vendas": round((cf_row.cf_vendas / cf_row.total_vendas * 100) if cf_row.total_vendas else 0, 1),
-            "valor_arrecadado": float(cf_row.cf_valor or 0)
-        }
+        """Perfis RFM do tenant, lidos dos scores persistidos em clientes_rfm
+        (ver RFMService) — não varre mais vendas a cada chamada."""
+        from app.services.rfm_service import RFMService
+        return RFMService.resumo_perfis(estabelecimento_id, janela_dias=days)
+
+
+class ClienteRFM(db.Model, MultiTenantMixin):
+    """Score RFM persistido por cliente (uma linha por cliente com compra na janela).
+
+    Recalculado em lote pelo RFMService (um SELECT agrupado + quintis por window
+    function). /clientes/rfm, relatórios e o consultor leem daqui."""
+    __tablename__ = "clientes_rfm"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    cliente_id = db.Column(db.Integer, db.ForeignKey("clientes.id", ondelete="CASCADE"), nullable=False)
+    janela_dias = db.Column(db.Integer, nullable=False, default=180)
+    ultima_compra = db.Column(db.DateTime)
+    recency_days = db.Column(db.Integer, default=0)
+    frequency = db.Column(db.Integer, default=0)
+    monetary = db.Column(db.Numeric(19, 4), default=0)
+    ticket_medio = db.Column(db.Numeric(19, 4), default=0)
+    vendas_fds = db.Column(db.Integer, default=0)
+    vendas_promo = db.Column(db.Integer, default=0)
+    recency_score = db.Column(db.SmallInteger, default=1)
+    frequency_score = db.Column(db.SmallInteger, default=1)
+    monetary_score = db.Column(db.SmallInteger, default=1)
+    segmento = db.Column(db.String(20), nullable=False, default="Regular")   # Campeão | Fiel | Em Risco | Perdido | Regular
+    perfil = db.Column(db.String(30), nullable=False, default="Regular")     # VIP | Premium | Final de Semana | ...
+    calculado_em = db.Column(db.DateTime, default=utcnow, nullable=False)
+    cliente = db.relationship("Cliente", backref=db.backref("rfm", uselist=False, lazy=True, passive_deletes=True))
+    __table_args__ = (
+        db.UniqueConstraint("cliente_id", name="uq_cliente_rfm_cliente"),
+        db.Index("ix_cliente_rfm_estab_segmento", "estabelecimento_id", "segmento"),
+    )
+
+    @property
+    def rfm_score(self) -> str:
+        return f"{self.recency_score}{self.frequency_score}{self.monetary_score}"
 
-        return {
-            "segments": segments_count,
-            "customers": customers,
-            "consumidor_final": consumidor_final,
-            "window_days": days
-        }
 
 class Fornecedor(db.Model, MultiTenantMixin, EnderecoMixin, SoftDeleteMixin, SerializableMixin, AuditMixin):
     __tablename__ = "fornecedores"
@@ -1133,11 +1168,7 @@ class Produto(db.Model, MultiTenantMixin, SoftDeleteMixin, SerializableMixin, Au
         custo_anterior = Decimal(str(self.preco_custo or 0))
         margem_anterior = Decimal(str(self.margem_lucro or 0))
         qtd_entrada = int(quantidade_entrada)
-        base = qtd_atual + qtd_entrada
-        if base <= 0: self.preco_custo = custo_entrada
-        else:
-            novo_custo = ((Decimal(qtd_atual) * custo_anterior) + (Decimal(qtd_entrada) * custo_entrada)) / Decimal(base)
-            self.preco_custo = novo_custo.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        self.preco_custo = Produto.custo_medio_ponderado(qtd_atual, custo_anterior, qtd_entrada, custo_entrada)
         if self.preco_venda and self.preco_custo and self.preco_custo > 0:
             self.margem_lucro = (self.preco_venda - self.preco_custo) / self.preco_custo * 100
         else: self.margem_lucro = 0
@@ -1151,6 +1182,15 @@ class Produto(db.Model, MultiTenantMixin, SoftDeleteMixin, SerializableMixin, Au
                 historico_kwargs["data_alteracao"] = data_alteracao
             db.session.add(HistoricoPrecos(**historico_kwargs))
 
+    @staticmethod
+    def custo_medio_ponderado(qtd_atual: int, custo_atual, qtd_entrada: int, custo_entrada) -> Decimal:
+        """CMP após uma entrada (mesma regra de recalcular_preco_custo_ponderado, sem tocar no objeto)."""
+        custo_entrada = Decimal(str(custo_entrada))
+        base = int(qtd_atual) + int(qtd_entrada)
+        if base <= 0: return custo_entrada
+        novo_custo = ((Decimal(int(qtd_atual)) * Decimal(str(custo_atual or 0))) + (Decimal(int(qtd_entrada)) * custo_entrada)) / Decimal(base)
+        return novo_custo.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
     @staticmethod
     def calcular_preco_por_markup(preco_custo, markup_percentual):
         if preco_custo is None or markup_percentual is None: return Decimal("0")
@@ -1214,7 +1254,8 @@ class Produto(db.Model, MultiTenantMixin, SoftDeleteMixin, SerializableMixin, Au
     def calcular_classificacao_abc_dinamica(estabelecimento_id: int, periodo_dias: int = 90):
         data_inicio = utcnow() - timedelta(days=periodo_dias)
         fat = db.session.query(VendaItem.produto_id, func.sum(VendaItem.total_item)).join(Venda)\
-            .filter(Venda.estabelecimento_id == estabelecimento_id, Venda.status == 'finalizada', Venda.data_venda >= data_inicio)\
+            .filter(Venda.estabelecimento_id == estabelecimento_id, Venda.status == 'finalizada', Venda.data_venda >= data_inicio,
+                    *janela_particionada(VendaItem, data_inicio))\
             .group_by(VendaItem.produto_id).order_by(func.sum(VendaItem.total_item).desc()).all()
         if not fat: return {}
         total = sum(Decimal(str(f[1] or 0)) for f in fat)
@@ -1400,6 +1441,33 @@ class ProdutoLote(db.Model, MultiTenantMixin):
                 "data_validade": self.data_validade.isoformat() if self.data_validade else None,
                 "dias_para_vencer": self.dias_para_vencer, "esta_vencido": self.esta_vencido, "ativo": self.ativo}
 
+class AlertaEstoque(db.Model, MultiTenantMixin):
+    """Estado persistido de um alerta de estoque/validade (ruptura, lote vencendo, vencido...).
+
+    Uma linha por condição (chave = tipo:produto:lote). O motor de alertas só
+    registra TRANSIÇÕES: novo → ativo enquanto a condição persiste → resolvido
+    quando some (e reabre como novo se voltar). /produtos/alertas lê daqui."""
+    __tablename__ = "alertas_estoque"
+    ESTADOS_ABERTOS = ("novo", "ativo")
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    chave = db.Column(db.String(80), nullable=False)
+    tipo = db.Column(db.String(30), nullable=False)  # estoque_baixo | lote_vencido | lote_vencendo_critico | lote_vencendo_medio | sem_movimento
+    nivel = db.Column(db.String(10), nullable=False)  # critico | alto | medio | baixo
+    estado = db.Column(db.String(10), nullable=False, default="novo")  # novo | ativo | resolvido
+    produto_id = db.Column(db.Integer, db.ForeignKey("produtos.id", ondelete="CASCADE"), nullable=False, index=True)
+    lote_id = db.Column(db.Integer, db.ForeignKey("produto_lotes.id", ondelete="CASCADE"), nullable=True, index=True)
+    dados = db.Column(db.JSON)
+    detectado_em = db.Column(db.DateTime, default=utcnow, nullable=False)
+    atualizado_em = db.Column(db.DateTime, default=utcnow, nullable=False)
+    resolvido_em = db.Column(db.DateTime)
+    notificado_em = db.Column(db.DateTime)
+    __table_args__ = (
+        db.UniqueConstraint("estabelecimento_id", "chave", name="uq_alerta_estoque_estab_chave"),
+        db.Index("ix_alerta_estoque_estab_estado", "estabelecimento_id", "estado"),
+    )
+
+
 class CatalogoMestre(db.Model):
     """
     Catálogo GLOBAL de produtos com EAN real (não pertence a nenhum tenant).
@@ -1568,6 +1636,7 @@ class PedidoVenda(db.Model, MultiTenantMixin, SoftDeleteMixin, SerializableMixin
     offline_uuid = db.Column(db.String(36)) # idempotencia
     
     itens = db.relationship("PedidoVendaItem", backref="pedido", cascade="all, delete-orphan", lazy=True)
+    __table_args__ = (db.Index("ix_pedido_venda_estab_data_status", "estabelecimento_id", "data_emissao", "status"),)
 
 class PedidoVendaItem(db.Model, MultiTenantMixin, SerializableMixin):
     __tablename__ = "pedido_venda_itens"
@@ -1587,6 +1656,7 @@ class PedidoVendaItem(db.Model, MultiTenantMixin, SerializableMixin):
 # ------------------------------------------------------------------------------
 class Venda(db.Model, MultiTenantMixin, SoftDeleteMixin, SerializableMixin, AuditMixin):
     __tablename__ = "vendas"
+    __chave_particao__ = "data_venda"  # partição mensal no Postgres (ParticionamentoService)
     id = db.Column(db.Integer, primary_key=True)
     estabelecimento_id = TenantID()
     cliente_id = db.Column(db.Integer, db.ForeignKey("clientes.id"), index=True)
@@ -1603,7 +1673,7 @@ class Venda(db.Model, MultiTenantMixin, SoftDeleteMixin, SerializableMixin, Audi
     observacoes = db.Column(db.Text)
     tipo_venda = db.Column(db.String(20), default="balcao")
     offline_uuid = db.Column(db.String(36))  # idempotência de venda offline (PDV móvel)
-    data_venda = db.Column(db.DateTime, default=utcnow)
+    data_venda = db.Column(db.DateTime, nullable=False, default=utcnow)
     data_cancelamento = db.Column(db.DateTime)
     motivo_cancelamento = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=utcnow)
@@ -1614,7 +1684,8 @@ class Venda(db.Model, MultiTenantMixin, SoftDeleteMixin, SerializableMixin, Audi
     itens = db.relationship("VendaItem", back_populates="venda", lazy=True, cascade="all, delete-orphan")
     pagamentos = db.relationship("Pagamento", back_populates="venda", lazy=True, cascade="all, delete-orphan")
     __table_args__ = (db.Index("ix_venda_codigo", "codigo"), db.Index("ix_venda_data", "data_venda"),
-                      db.Index("ix_venda_tipo", "tipo_venda"), db.UniqueConstraint("estabelecimento_id", "codigo", name="uq_venda_estab_codigo"),
+                      db.Index("ix_venda_tipo", "tipo_venda"), db.Index("ix_venda_estab_data_status", "estabelecimento_id", "data_venda", "status"),
+                      db.UniqueConstraint("estabelecimento_id", "codigo", name="uq_venda_estab_codigo"),
                       db.UniqueConstraint("estabelecimento_id", "offline_uuid", name="uq_venda_estab_offline_uuid"))
 
     def atualizar_totais(self):
@@ -1631,8 +1702,20 @@ class Venda(db.Model, MultiTenantMixin, SoftDeleteMixin, SerializableMixin, Audi
         data["pagamentos"] = [p.to_dict() for p in self.pagamentos] if self.pagamentos else []
         return data
 
+
+@event.listens_for(Venda, "before_insert")
+@event.listens_for(Venda, "before_update")
+def _normalizar_data_venda(mapper, connection, target):
+    """data_venda nunca fica nula: os filtros de período usam a coluna direto
+    (índice estabelecimento/data/status), sem COALESCE com created_at."""
+    if target.data_venda is None:
+        target.data_venda = target.created_at or utcnow()
+
+
 class VendaItem(db.Model, MultiTenantMixin, SerializableMixin, AuditMixin):
     __tablename__ = "venda_itens"
+    __chave_particao__ = "created_at"
+    __particao_filha__ = True
     id = db.Column(db.Integer, primary_key=True)
     estabelecimento_id = TenantID()
     venda_id = db.Column(db.Integer, db.ForeignKey("vendas.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -1650,6 +1733,7 @@ class VendaItem(db.Model, MultiTenantMixin, SerializableMixin, AuditMixin):
     venda = db.relationship("Venda", back_populates="itens")
     produto = db.relationship("Produto", backref=db.backref("itens_venda", lazy=True))
     __table_args__ = (db.Index("ix_venda_item_venda", "venda_id"), db.Index("ix_venda_item_produto", "produto_id"),
+                      db.Index("ix_venda_item_created", "created_at"),
                       db.UniqueConstraint("sync_uuid", name="uq_venda_itens_sync_uuid"))
 
     def to_dict(self, depth=0):
@@ -1657,8 +1741,41 @@ class VendaItem(db.Model, MultiTenantMixin, SerializableMixin, AuditMixin):
         data["produto_nome"] = self.produto_nome
         return data
 
+class CarrinhoPdv(db.Model, MultiTenantMixin):
+    """Estado quente do carrinho do PDV (uma linha por venda em andamento).
+
+    Os bipes do caixa alteram só esta linha: ``itens_json`` (chaveado pelo
+    produto), totais e ``versao``. A gravação é um UPDATE condicional na versão
+    lida (controle otimista): dois terminais no mesmo carrinho não se
+    sobrescrevem, o segundo recebe 409 com o estado atual. Venda/VendaItem
+    (``venda_id``, status em_andamento) só recebem o carrinho nos checkpoints
+    periódicos e na finalização. Mantido pelo carrinho_service."""
+    __tablename__ = "carrinhos_pdv"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    venda_id = db.Column(db.Integer, db.ForeignKey("vendas.id", ondelete="SET NULL"), unique=True)
+    funcionario_id = db.Column(db.Integer, db.ForeignKey("funcionarios.id"), nullable=False)
+    cliente_id = db.Column(db.Integer, db.ForeignKey("clientes.id"))
+    codigo_temp = db.Column(db.String(50))
+    status = db.Column(db.String(20), nullable=False, default="aberto")  # aberto | finalizado | descartado
+    versao = db.Column(db.Integer, nullable=False, default=1)
+    itens_json = db.Column(db.JSON, nullable=False, default=list)
+    subtotal = db.Column(db.Numeric(19, 4), nullable=False, default=0)
+    desconto = db.Column(db.Numeric(19, 4), nullable=False, default=0)
+    total = db.Column(db.Numeric(19, 4), nullable=False, default=0)
+    quantidade_itens = db.Column(db.Numeric(10, 3), nullable=False, default=0)
+    checkpoint_versao = db.Column(db.Integer, nullable=False, default=0)  # versão já gravada em VendaItem
+    checkpoint_em = db.Column(db.DateTime)
+    venda_final_id = db.Column(db.Integer)  # Venda finalizada que recebeu o carrinho
+    criado_em = db.Column(db.DateTime, nullable=False, default=utcnow)
+    atualizado_em = db.Column(db.DateTime, nullable=False, default=utcnow)
+    __table_args__ = (db.Index("ix_carrinho_pdv_estab_status", "estabelecimento_id", "status"),)
+
+
 class Pagamento(db.Model, MultiTenantMixin, SerializableMixin):
     __tablename__ = "pagamentos"
+    __chave_particao__ = "created_at"
+    __particao_filha__ = True
     id = db.Column(db.Integer, primary_key=True)
     estabelecimento_id = TenantID()
     venda_id = db.Column(db.Integer, db.ForeignKey("vendas.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -1677,13 +1794,14 @@ class Pagamento(db.Model, MultiTenantMixin, SerializableMixin):
     updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
     venda = db.relationship("Venda", back_populates="pagamentos")
     __table_args__ = (db.Index("ix_pagamento_venda", "venda_id"), db.Index("ix_pagamento_data", "data_pagamento"),
-                      db.Index("ix_pagamento_forma", "forma_pagamento"))
+                      db.Index("ix_pagamento_forma", "forma_pagamento"), db.Index("ix_pagamento_created", "created_at"))
 
     def to_dict(self, depth=0):
         return super().to_dict(depth=depth)
 
 class MovimentacaoEstoque(db.Model, MultiTenantMixin, SerializableMixin, AuditMixin):
     __tablename__ = "movimentacoes_estoque"
+    __chave_particao__ = "created_at"
     id = db.Column(db.Integer, primary_key=True)
     estabelecimento_id = TenantID()
     produto_id = db.Column(db.Integer, db.ForeignKey("produtos.id"), nullable=False, index=True)
@@ -1704,7 +1822,8 @@ class MovimentacaoEstoque(db.Model, MultiTenantMixin, SerializableMixin, AuditMi
     venda = db.relationship("Venda", backref=db.backref("movimentacoes_estoque_venda", lazy=True))
     funcionario = db.relationship("Funcionario", backref=db.backref("movimentacoes", lazy=True))
     lote = db.relationship("ProdutoLote", backref=db.backref("movimentacoes_lote", lazy=True))
-    __table_args__ = (db.Index("ix_mov_estoque_produto", "produto_id"), db.Index("ix_mov_estoque_data", "created_at"))
+    __table_args__ = (db.Index("ix_mov_estoque_produto", "produto_id"), db.Index("ix_mov_estoque_data", "created_at"),
+                      db.Index("ix_mov_estoque_estab_data_tipo", "estabelecimento_id", "created_at", "tipo"))
 
 class HistoricoPrecos(db.Model, MultiTenantMixin, SerializableMixin):
     __tablename__ = "historico_precos"
@@ -1814,7 +1933,64 @@ class ContaPagar(db.Model, MultiTenantMixin, SerializableMixin, AuditMixin):
     estabelecimento = db.relationship("Estabelecimento", backref=db.backref("contas_pagar", lazy=True))
     fornecedor = db.relationship("Fornecedor", backref=db.backref("contas_pagar", lazy=True))
     pedido_compra = db.relationship("PedidoCompra", backref=db.backref("conta_pagar", uselist=False))
-    __table_args__ = (db.Index("ix_conta_pagar_vencimento", "data_vencimento"), db.Index("ix_conta_pagar_status", "status"))
+    __table_args__ = (db.Index("ix_conta_pagar_vencimento", "data_vencimento"), db.Index("ix_conta_pagar_status", "status"),
+                      db.Index("ix_conta_pagar_estab_venc_status", "estabelecimento_id", "data_vencimento", "status"))
+
+
+class FornecedorMetrica(db.Model, MultiTenantMixin):
+    """Snapshot analítico por fornecedor: pedidos, volume comprado, última
+    compra, classificação e contas a pagar em aberto, além do nome/CNPJ já
+    normalizados para busca.
+
+    Mantido incrementalmente no after_flush (listener abaixo) a cada mudança em
+    fornecedores, pedidos_compra e contas_pagar; listagem, busca e estatísticas
+    de fornecedores leem daqui em vez de agregar por linha."""
+    __tablename__ = "fornecedores_metricas"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    fornecedor_id = db.Column(db.Integer, db.ForeignKey("fornecedores.id", ondelete="CASCADE"), nullable=False)
+    nome_fantasia = db.Column(db.String(150), nullable=False)
+    nome_busca = db.Column(db.String(500), nullable=False, default="")  # minúsculo, sem acento
+    cnpj_digitos = db.Column(db.String(14), nullable=False, default="")
+    estado = db.Column(db.String(2))
+    ativo = db.Column(db.Boolean, nullable=False, default=True)
+    data_cadastro = db.Column(db.DateTime)
+    total_pedidos = db.Column(db.Integer, nullable=False, default=0)
+    pedidos_recebidos = db.Column(db.Integer, nullable=False, default=0)
+    valor_comprado = db.Column(db.Numeric(19, 4), nullable=False, default=0)
+    ultima_compra = db.Column(db.DateTime)
+    contas_abertas = db.Column(db.Integer, nullable=False, default=0)
+    valor_em_aberto = db.Column(db.Numeric(19, 4), nullable=False, default=0)
+    classificacao = db.Column(db.String(20), nullable=False, default="NOVO")
+    atualizado_em = db.Column(db.DateTime, default=utcnow, nullable=False)
+    __table_args__ = (
+        db.UniqueConstraint("fornecedor_id", name="uq_fornecedor_metrica_fornecedor"),
+        db.Index("ix_fornecedor_metrica_estab_nome", "estabelecimento_id", "nome_busca"),
+        db.Index("ix_fornecedor_metrica_estab_cnpj", "estabelecimento_id", "cnpj_digitos"),
+    )
+
+
+def _fornecedores_afetados(session) -> set:
+    """fornecedor_id tocados pelo flush (inclui o anterior quando o pedido/conta troca de fornecedor)."""
+    ids = set()
+    for colecao in (session.new, session.dirty, session.deleted):
+        for obj in colecao:
+            if isinstance(obj, Fornecedor):
+                if obj.id is not None: ids.add(obj.id)
+            elif isinstance(obj, (PedidoCompra, ContaPagar)):
+                if obj.fornecedor_id is not None: ids.add(obj.fornecedor_id)
+                hist = inspect(obj).attrs.fornecedor_id.history
+                ids.update(i for i in (hist.deleted or ()) if i is not None)
+    return ids
+
+
+@event.listens_for(db.session, "after_flush")
+def _atualizar_metricas_fornecedor(session, flush_context):
+    ids = _fornecedores_afetados(session)
+    if not ids:
+        return
+    from app.services.fornecedor_metricas_service import FornecedorMetricasService
+    FornecedorMetricasService.recalcular(ids, connection=session.connection())
 
 class ContaReceber(db.Model, MultiTenantMixin, SerializableMixin, AuditMixin):
     __tablename__ = "contas_receber"
@@ -1836,7 +2012,8 @@ class ContaReceber(db.Model, MultiTenantMixin, SerializableMixin, AuditMixin):
     estabelecimento = db.relationship("Estabelecimento", backref=db.backref("contas_receber", lazy=True))
     cliente = db.relationship("Cliente", backref=db.backref("contas_receber", lazy=True))
     venda = db.relationship("Venda", backref=db.backref("contas_receber", lazy=True))
-    __table_args__ = (db.Index("ix_conta_receber_vencimento", "data_vencimento"), db.Index("ix_conta_receber_cliente", "cliente_id"))
+    __table_args__ = (db.Index("ix_conta_receber_vencimento", "data_vencimento"), db.Index("ix_conta_receber_cliente", "cliente_id"),
+                      db.Index("ix_conta_receber_estab_venc_status", "estabelecimento_id", "data_vencimento", "status"))
 
 class Despesa(db.Model, MultiTenantMixin, SerializableMixin, AuditMixin):
     __tablename__ = "despesas"
@@ -1855,7 +2032,71 @@ class Despesa(db.Model, MultiTenantMixin, SerializableMixin, AuditMixin):
     observacoes = db.Column(db.Text)
     estabelecimento = db.relationship("Estabelecimento", backref=db.backref("despesas", lazy=True))
     fornecedor = db.relationship("Fornecedor", backref=db.backref("despesas", lazy=True))
-    __table_args__ = (db.Index("ix_despesa_data", "data_despesa"), db.Index("ix_despesa_categoria", "categoria"))
+    __table_args__ = (db.Index("ix_despesa_data", "data_despesa"), db.Index("ix_despesa_categoria", "categoria"),
+                      db.Index("ix_despesa_estab_data", "estabelecimento_id", "data_despesa"))
+
+
+class FinanceiroMensal(db.Model, MultiTenantMixin):
+    """Razão financeiro mensal: uma linha por (mês, rubrica, categoria) da loja.
+
+    Rubricas: despesas por categoria (e a parte recorrente), contas a pagar em
+    aberto por vencimento e pagas por data de pagamento, contas a receber em
+    aberto e recebidas, receita, valor recebido e CMV das vendas e custo da
+    folha dos meses fechados. Mantido por deltas (before/after_flush, abaixo) e
+    reconciliado com as tabelas de origem todas as noites; as telas financeiras
+    leem o período inteiro numa consulta pelo índice único."""
+    __tablename__ = "financeiro_mensal"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    competencia = db.Column(db.Date, nullable=False)  # 1º dia do mês (fuso da loja)
+    rubrica = db.Column(db.String(30), nullable=False)
+    categoria = db.Column(db.String(50), nullable=False, default="")
+    valor = db.Column(db.Numeric(19, 4), nullable=False, default=0)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, default=utcnow, nullable=False)
+    __table_args__ = (
+        db.UniqueConstraint("estabelecimento_id", "competencia", "rubrica", "categoria",
+                            name="uq_financeiro_mensal_chave"),
+    )
+
+
+def _ids_financeiros(session) -> Dict[str, set]:
+    """ids das linhas de origem do razão mensal tocadas pelo flush, por fonte."""
+    ids = {"despesas": set(), "contas_pagar": set(), "contas_receber": set(), "vendas": set()}
+    for colecao in (session.new, session.dirty, session.deleted):
+        for obj in colecao:
+            if isinstance(obj, Despesa):
+                ids["despesas"].add(obj.id)
+            elif isinstance(obj, ContaPagar):
+                ids["contas_pagar"].add(obj.id)
+            elif isinstance(obj, ContaReceber):
+                ids["contas_receber"].add(obj.id)
+            elif isinstance(obj, Venda):
+                ids["vendas"].add(obj.id)
+            elif isinstance(obj, VendaItem):
+                ids["vendas"].add(obj.venda_id if obj.venda_id is not None else getattr(obj.venda, "id", None))
+    return {fonte: {i for i in v if i is not None} for fonte, v in ids.items()}
+
+
+@event.listens_for(db.session, "before_flush")
+def _financeiro_antes_do_flush(session, flush_context, instances):
+    ids = _ids_financeiros(session)
+    if not any(ids.values()):
+        return
+    from app.services.financeiro_mensal_service import FinanceiroMensalService
+    session.info["financeiro_antes"] = FinanceiroMensalService.contribuicoes(ids, session.connection())
+
+
+@event.listens_for(db.session, "after_flush")
+def _financeiro_depois_do_flush(session, flush_context):
+    antes = session.info.pop("financeiro_antes", None)
+    ids = _ids_financeiros(session)
+    if not any(ids.values()) and not antes:
+        return
+    from app.services.financeiro_mensal_service import FinanceiroMensalService
+    conn = session.connection()
+    FinanceiroMensalService.aplicar_deltas(antes or {}, FinanceiroMensalService.contribuicoes(ids, conn), conn)
+
 
 class NotaFiscalEntrada(db.Model, MultiTenantMixin, SerializableMixin):
     """NF-e de compra (entrada) importada via XML do fornecedor.
@@ -1922,9 +2163,12 @@ class DocumentoFiscal(db.Model, MultiTenantMixin, SerializableMixin):
     serie = db.Column(db.String(5))
     chave_acesso = db.Column(db.String(44))
     protocolo = db.Column(db.String(30))
-    status = db.Column(db.String(20), default="processando")  # processando|autorizado|rejeitado|cancelado|erro|contingencia
+    status = db.Column(db.String(20), default="processando")  # fila|processando|autorizado|rejeitado|cancelado|erro|contingencia
     motivo_rejeicao = db.Column(db.Text)
     valor_total = db.Column(db.Numeric(19, 4), default=0)
+    tentativas = db.Column(db.Integer, default=0, nullable=False)  # envios/consultas feitos pela fila de emissão
+    proxima_tentativa_em = db.Column(db.DateTime)                   # quando a fila pode pegar o documento de novo
+    contingencia_em = db.Column(db.DateTime)                        # entrada em contingência offline (tpEmis 9)
     danfe_url = db.Column(db.String(500))
     xml_url = db.Column(db.String(500))
     xml_content = db.Column(db.Text)
@@ -1939,6 +2183,7 @@ class DocumentoFiscal(db.Model, MultiTenantMixin, SerializableMixin):
         db.Index("ix_docfiscal_status", "status"),
         db.Index("ix_docfiscal_chave", "chave_acesso"),
         db.UniqueConstraint("estabelecimento_id", "referencia", name="uq_docfiscal_estab_ref"),
+        db.Index("ix_docfiscal_fila", "status", "proxima_tentativa_em"),
     )
 
     def to_dict(self, depth=0):
@@ -1948,11 +2193,231 @@ class DocumentoFiscal(db.Model, MultiTenantMixin, SerializableMixin):
             "numero": self.numero, "serie": self.serie, "chave_acesso": self.chave_acesso,
             "protocolo": self.protocolo, "status": self.status, "motivo_rejeicao": self.motivo_rejeicao,
             "valor_total": float(self.valor_total or 0), "danfe_url": self.danfe_url,
-            "xml_url": self.xml_url, "qr_code": self.qr_code,
+            "xml_url": self.xml_url, "qr_code": self.qr_code, "tentativas": self.tentativas or 0,
+            "contingencia_em": self.contingencia_em.isoformat() if self.contingencia_em else None,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "autorizado_em": self.autorizado_em.isoformat() if self.autorizado_em else None,
         }
 
+
+class NumeracaoFiscal(db.Model, MultiTenantMixin):
+    """Sequência de numeração por (estabelecimento, modelo, série).
+
+    O número é reservado com um UPDATE atômico (proximo_numero + 1 ... RETURNING)
+    numa transação curta, antes de falar com o gateway: dois caixas nunca pegam
+    o mesmo número e a trava da linha não atravessa a latência da SEFAZ."""
+    __tablename__ = "numeracao_fiscal"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    modelo = db.Column(db.String(2), nullable=False, default="65")
+    serie = db.Column(db.Integer, nullable=False, default=1)
+    proximo_numero = db.Column(db.Integer, nullable=False, default=1)
+    atualizado_em = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
+    __table_args__ = (
+        db.UniqueConstraint("estabelecimento_id", "modelo", "serie", name="uq_numeracao_fiscal_serie"),
+    )
+
+
+class NumeracaoFiscalLacuna(db.Model, MultiTenantMixin):
+    """Número reservado que não virou nota autorizada (rejeição/erro definitivo).
+
+    Cada lacuna precisa ser inutilizada na SEFAZ; sai da lista quando o mesmo
+    número acaba autorizado (reemissão) ou quando é marcada como inutilizada."""
+    __tablename__ = "numeracao_fiscal_lacunas"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    modelo = db.Column(db.String(2), nullable=False, default="65")
+    serie = db.Column(db.Integer, nullable=False, default=1)
+    numero = db.Column(db.Integer, nullable=False)
+    documento_id = db.Column(db.Integer, db.ForeignKey("documentos_fiscais.id", ondelete="SET NULL"))
+    motivo = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, default=utcnow, nullable=False)
+    inutilizada_em = db.Column(db.DateTime)
+    __table_args__ = (
+        db.UniqueConstraint("estabelecimento_id", "modelo", "serie", "numero", name="uq_numeracao_lacuna_numero"),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id, "modelo": self.modelo, "serie": self.serie, "numero": self.numero,
+            "documento_id": self.documento_id, "motivo": self.motivo,
+            "criado_em": self.criado_em.isoformat() if self.criado_em else None,
+            "inutilizada_em": self.inutilizada_em.isoformat() if self.inutilizada_em else None,
+        }
+
+class EmailFila(db.Model):
+    """Fila persistente de e-mails de saída (app.services.email_fila).
+
+    status: pendente → enviado | falhou (dead-letter após o máximo de tentativas).
+    estabelecimento_id é opcional: e-mails de plataforma (leads) não têm loja."""
+    __tablename__ = "emails_fila"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = db.Column(db.Integer, db.ForeignKey("estabelecimentos.id", ondelete="CASCADE"), index=True)
+    tipo = db.Column(db.String(30), nullable=False, default="generico")
+    destinatario = db.Column(db.String(200), nullable=False)
+    assunto = db.Column(db.String(300), nullable=False)
+    corpo_texto = db.Column(db.Text)
+    corpo_html = db.Column(db.Text)
+    com_logo = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(20), nullable=False, default="pendente")
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa_em = db.Column(db.DateTime)
+    ultimo_erro = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, default=utcnow, nullable=False)
+    enviado_em = db.Column(db.DateTime)
+    __table_args__ = (db.Index("ix_emails_fila_pendentes", "status", "proxima_tentativa_em"),)
+
+    def to_dict(self):
+        return {
+            "id": self.id, "tipo": self.tipo, "destinatario": self.destinatario, "assunto": self.assunto,
+            "status": self.status, "tentativas": self.tentativas, "ultimo_erro": self.ultimo_erro,
+            "criado_em": self.criado_em.isoformat() if self.criado_em else None,
+            "enviado_em": self.enviado_em.isoformat() if self.enviado_em else None,
+        }
+
+
+class MidiaUpload(db.Model):
+    """Upload no spool local aguardando otimização/publicação (app.services.midia_service).
+
+    O registro de destino (destino_tabela/destino_id/destino_coluna) recebe a
+    URL provisória /uploads/midia/<handle> na hora e a URL final quando o
+    worker termina. status: spool → pronto | falhou."""
+    __tablename__ = "midia_uploads"
+    id = db.Column(db.Integer, primary_key=True)
+    handle = db.Column(db.String(32), nullable=False, unique=True)
+    estabelecimento_id = db.Column(db.Integer, db.ForeignKey("estabelecimentos.id", ondelete="CASCADE"), index=True)
+    categoria = db.Column(db.String(40), nullable=False)
+    nome = db.Column(db.String(200), nullable=False)
+    content_type = db.Column(db.String(100))
+    tamanho = db.Column(db.Integer, nullable=False, default=0)
+    caminho_spool = db.Column(db.String(500))
+    host = db.Column(db.String(100))
+    status = db.Column(db.String(20), nullable=False, default="spool")
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa_em = db.Column(db.DateTime)
+    ultimo_erro = db.Column(db.Text)
+    url = db.Column(db.String(500))
+    url_miniatura = db.Column(db.String(500))
+    destino_tabela = db.Column(db.String(60))
+    destino_id = db.Column(db.Integer)
+    destino_coluna = db.Column(db.String(60))
+    criado_em = db.Column(db.DateTime, default=utcnow, nullable=False)
+    concluido_em = db.Column(db.DateTime)
+    __table_args__ = (db.Index("ix_midia_uploads_pendentes", "status", "proxima_tentativa_em"),)
+
+    @property
+    def url_provisoria(self):
+        return f"/uploads/midia/{self.handle}"
+
+    def to_dict(self):
+        return {
+            "handle": self.handle, "categoria": self.categoria, "status": self.status,
+            "url": self.url or self.url_provisoria, "url_miniatura": self.url_miniatura,
+            "tentativas": self.tentativas, "ultimo_erro": self.ultimo_erro,
+            "criado_em": self.criado_em.isoformat() if self.criado_em else None,
+            "concluido_em": self.concluido_em.isoformat() if self.concluido_em else None,
+        }
+
+
+class ExportacaoArquivo(db.Model):
+    """Exportação grande gerada em background (app.services.exportacao_service).
+
+    filtros_json guarda os parâmetros da requisição; o arquivo fica em
+    EXPORTACAO_FOLDER até expira_em. status: pendente → pronto | falhou."""
+    __tablename__ = "exportacoes_arquivos"
+    id = db.Column(db.Integer, primary_key=True)
+    handle = db.Column(db.String(32), nullable=False, unique=True)
+    estabelecimento_id = db.Column(db.Integer, db.ForeignKey("estabelecimentos.id", ondelete="CASCADE"), index=True)
+    funcionario_id = db.Column(db.Integer)
+    tipo = db.Column(db.String(40), nullable=False)
+    formato = db.Column(db.String(10), nullable=False)
+    filtros_json = db.Column(db.Text)
+    nome_arquivo = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pendente")
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa_em = db.Column(db.DateTime)
+    ultimo_erro = db.Column(db.Text)
+    caminho = db.Column(db.String(500))
+    linhas = db.Column(db.Integer)
+    tamanho = db.Column(db.BigInteger)
+    criado_em = db.Column(db.DateTime, default=utcnow, nullable=False)
+    concluido_em = db.Column(db.DateTime)
+    expira_em = db.Column(db.DateTime)
+    __table_args__ = (db.Index("ix_exportacoes_arquivos_pendentes", "status", "proxima_tentativa_em"),)
+
+    def to_dict(self):
+        return {
+            "handle": self.handle, "tipo": self.tipo, "formato": self.formato, "status": self.status,
+            "nome_arquivo": self.nome_arquivo, "linhas": self.linhas, "tamanho": self.tamanho,
+            "tentativas": self.tentativas, "ultimo_erro": self.ultimo_erro,
+            "status_url": f"/api/relatorios/exportacoes/{self.handle}",
+            "download_url": f"/api/relatorios/exportacoes/{self.handle}/arquivo" if self.status == "pronto" else None,
+            "criado_em": self.criado_em.isoformat() if self.criado_em else None,
+            "concluido_em": self.concluido_em.isoformat() if self.concluido_em else None,
+            "expira_em": self.expira_em.isoformat() if self.expira_em else None,
+        }
+
+
+class ImportacaoArquivo(db.Model):
+    """Importação em massa de CSV (app.services.importacao_service).
+
+    O arquivo fica no spool (IMPORTACAO_FOLDER) até o fim do job; cada bloco
+    de linhas é gravado na mesma transação que avança linhas_processadas, o que
+    permite retomar de onde parou. status: pendente → processando → concluido
+    | falhou. simulacao=True valida e conta sem gravar nada."""
+    __tablename__ = "importacoes_arquivos"
+    id = db.Column(db.Integer, primary_key=True)
+    handle = db.Column(db.String(32), nullable=False, unique=True)
+    estabelecimento_id = db.Column(db.Integer, db.ForeignKey("estabelecimentos.id", ondelete="CASCADE"),
+                                   nullable=False, index=True)
+    funcionario_id = db.Column(db.Integer)
+    tipo = db.Column(db.String(40), nullable=False)  # produtos | clientes
+    nome_arquivo = db.Column(db.String(200), nullable=False)
+    caminho = db.Column(db.String(500))
+    simulacao = db.Column(db.Boolean, nullable=False, default=False)
+    atualizar_existentes = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(20), nullable=False, default="pendente")
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa_em = db.Column(db.DateTime)
+    ultimo_erro = db.Column(db.Text)
+    total_linhas = db.Column(db.Integer)
+    linhas_processadas = db.Column(db.Integer, nullable=False, default=0)
+    inseridos = db.Column(db.Integer, nullable=False, default=0)
+    atualizados = db.Column(db.Integer, nullable=False, default=0)
+    rejeitados = db.Column(db.Integer, nullable=False, default=0)
+    erros_json = db.Column(db.Text)  # [{"linha", "erro"}], limitado a importacao_service._MAX_ERROS
+    criado_em = db.Column(db.DateTime, default=utcnow, nullable=False)
+    iniciado_em = db.Column(db.DateTime)
+    concluido_em = db.Column(db.DateTime)
+    __table_args__ = (db.Index("ix_importacoes_arquivos_pendentes", "status", "proxima_tentativa_em"),)
+
+    @property
+    def erros(self) -> List[dict]:
+        try:
+            return json.loads(self.erros_json or "[]")
+        except ValueError:
+            return []
+
+    def to_dict(self):
+        progresso = None
+        if self.total_linhas:
+            progresso = round(min(100.0, 100.0 * (self.linhas_processadas or 0) / self.total_linhas), 1)
+        elif self.status == "concluido":
+            progresso = 100.0
+        return {
+            "handle": self.handle, "tipo": self.tipo, "nome_arquivo": self.nome_arquivo, "status": self.status,
+            "simulacao": bool(self.simulacao), "atualizar_existentes": bool(self.atualizar_existentes),
+            "total_linhas": self.total_linhas, "linhas_processadas": self.linhas_processadas or 0,
+            "progresso": progresso, "inseridos": self.inseridos or 0, "atualizados": self.atualizados or 0,
+            "rejeitados": self.rejeitados or 0, "erros": self.erros, "tentativas": self.tentativas,
+            "ultimo_erro": self.ultimo_erro,
+            "status_url": f"/api/{self.tipo}/importar/{self.handle}",
+            "criado_em": self.criado_em.isoformat() if self.criado_em else None,
+            "iniciado_em": self.iniciado_em.isoformat() if self.iniciado_em else None,
+            "concluido_em": self.concluido_em.isoformat() if self.concluido_em else None,
+        }
+
+
 class SyncHeartbeat(db.Model):
     """Batimento do sync local→Aiven (linha única id=1). Permite detectar sync parado."""
     __tablename__ = "sync_heartbeat"
@@ -2027,6 +2492,97 @@ class MovimentacaoCaixa(db.Model, MultiTenantMixin, SerializableMixin, AuditMixi
     __table_args__ = (db.Index("ix_mov_caixa_caixa", "caixa_id"), db.Index("ix_mov_caixa_tipo", "tipo"))
 
 
+def normalizar_forma_caixa(forma_raw) -> str:
+    """Forma de pagamento canônica do caixa: dinheiro | cartao_credito | cartao_debito | pix | fiado | outros."""
+    if not forma_raw: return "outros"
+    key = str(forma_raw).strip().lower()
+    key = key.replace("é", "e").replace("ê", "e").replace("ã", "a").replace("á", "a")
+    if "credito" in key: return "cartao_credito"
+    if "debito" in key: return "cartao_debito"
+    if "pix" in key: return "pix"
+    if "dinheiro" in key: return "dinheiro"
+    if "fiado" in key: return "fiado"
+    return "outros"
+
+
+class CaixaTotal(db.Model, MultiTenantMixin):
+    """Totais correntes do caixa por (tipo de movimentação, forma de pagamento).
+
+    Mantidos por UPSERT atômico na mesma transação de cada insert/delete em
+    movimentacoes_caixa (listeners abaixo): resumo e fechamento leem daqui em
+    vez de varrer o livro de movimentações. CaixaService.reconciliar confere
+    contra o livro."""
+    __tablename__ = "caixa_totais"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    caixa_id = db.Column(db.Integer, db.ForeignKey("caixas.id", ondelete="CASCADE"), nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)
+    forma_pagamento = db.Column(db.String(20), nullable=False)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Numeric(19, 4), nullable=False, default=0)
+    __table_args__ = (
+        db.UniqueConstraint("caixa_id", "tipo", "forma_pagamento", name="uq_caixa_total_chave"),
+    )
+
+
+def _acumular_total_caixa(connection, mov, sinal: int, tipo=None, forma=None, valor=None):
+    """UPSERT atômico (quantidade/total += delta) na linha de totais do caixa."""
+    tabela = CaixaTotal.__table__
+    tipo = str(tipo if tipo is not None else mov.tipo or "").lower()
+    forma = normalizar_forma_caixa(forma if forma is not None else mov.forma_pagamento)
+    valor = Decimal(str(valor if valor is not None else mov.valor or 0)) * sinal
+    chave = {"caixa_id": mov.caixa_id, "tipo": tipo, "forma_pagamento": forma}
+
+    dialeto = connection.dialect.name
+    if dialeto in ("postgresql", "sqlite"):
+        if dialeto == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as _insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as _insert
+        stmt = _insert(tabela).values(
+            estabelecimento_id=mov.estabelecimento_id, quantidade=sinal, total=valor, **chave
+        )
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=["caixa_id", "tipo", "forma_pagamento"],
+            set_={"quantidade": tabela.c.quantidade + sinal, "total": tabela.c.total + valor},
+        ))
+        return
+
+    res = connection.execute(
+        tabela.update()
+        .where(tabela.c.caixa_id == mov.caixa_id, tabela.c.tipo == tipo, tabela.c.forma_pagamento == forma)
+        .values(quantidade=tabela.c.quantidade + sinal, total=tabela.c.total + valor)
+    )
+    if not res.rowcount:
+        connection.execute(tabela.insert().values(
+            estabelecimento_id=mov.estabelecimento_id, quantidade=sinal, total=valor, **chave
+        ))
+
+
+@event.listens_for(MovimentacaoCaixa, "after_insert")
+def _mov_caixa_inserida(mapper, connection, target):
+    _acumular_total_caixa(connection, target, 1)
+
+
+@event.listens_for(MovimentacaoCaixa, "after_delete")
+def _mov_caixa_removida(mapper, connection, target):
+    _acumular_total_caixa(connection, target, -1)
+
+
+@event.listens_for(MovimentacaoCaixa, "after_update")
+def _mov_caixa_alterada(mapper, connection, target):
+    estado = inspect(target)
+    campos = ("tipo", "forma_pagamento", "valor")
+    if not any(estado.attrs[c].history.has_changes() for c in campos):
+        return
+    anterior = {}
+    for c in campos:
+        hist = estado.attrs[c].history
+        anterior[c] = hist.deleted[0] if hist.deleted else getattr(target, c)
+    _acumular_total_caixa(connection, target, -1, anterior["tipo"], anterior["forma_pagamento"], anterior["valor"])
+    _acumular_total_caixa(connection, target, 1)
+
+
 class DashboardMetrica(db.Model, MultiTenantMixin):
     __tablename__ = "dashboard_metricas"
     id = db.Column(db.Integer, primary_key=True)
@@ -2127,7 +2683,8 @@ class RegistroPonto(db.Model, MultiTenantMixin):
     funcionario = db.relationship("Funcionario", backref=db.backref("registros_ponto", lazy=True, cascade="all, delete-orphan"))
     estabelecimento = db.relationship("Estabelecimento", backref=db.backref("registros_ponto", lazy=True))
     __table_args__ = (db.Index("ix_ponto_funcionario_data", "funcionario_id", "data"),
-                      db.Index("ix_ponto_estabelecimento", "estabelecimento_id"), db.Index("ix_ponto_data", "data"))
+                      db.Index("ix_ponto_estabelecimento", "estabelecimento_id"), db.Index("ix_ponto_data", "data"),
+                      db.Index("ix_ponto_estab_data_status", "estabelecimento_id", "data", "status"))
 
     def to_dict(self):
         return {'id': self.id, 'funcionario_id': self.funcionario_id,
@@ -2142,6 +2699,39 @@ class RegistroPonto(db.Model, MultiTenantMixin):
                 'observacao': self.observacao, 'status': self.status,
                 'minutos_atraso': self.minutos_atraso, 'created_at': self.created_at.isoformat() if self.created_at else None}
 
+class PontoDiario(db.Model, MultiTenantMixin):
+    """Consolidado diário do ponto: uma linha por funcionário por dia com batida.
+
+    Mantido pelo PontoDiarioService a cada registro/ajuste/exclusão de
+    RegistroPonto (mesma regra do espelho). Estatísticas, relatórios, espelho,
+    folha e o dashboard de RH agrupam daqui em vez de varrer as batidas.
+    Faltas = dias úteis do período sem linha ``presente``."""
+    __tablename__ = "ponto_diario"
+    id = db.Column(db.Integer, primary_key=True)
+    estabelecimento_id = TenantID()
+    funcionario_id = db.Column(db.Integer, db.ForeignKey("funcionarios.id", ondelete="CASCADE"), nullable=False)
+    data = db.Column(db.Date, nullable=False)
+    primeira_entrada = db.Column(db.Time)
+    inicio_intervalo = db.Column(db.Time)
+    fim_intervalo = db.Column(db.Time)
+    ultima_saida = db.Column(db.Time)
+    presente = db.Column(db.Boolean, nullable=False, default=False)  # houve entrada no dia
+    batidas = db.Column(db.Integer, nullable=False, default=0)
+    batidas_atrasadas = db.Column(db.Integer, nullable=False, default=0)  # status == "atrasado"
+    minutos_trabalhados = db.Column(db.Integer, nullable=False, default=0)
+    minutos_atraso = db.Column(db.Integer, nullable=False, default=0)  # soma das batidas do dia
+    minutos_atraso_entrada = db.Column(db.Integer, nullable=False, default=0)
+    entrada_atrasada = db.Column(db.Boolean, nullable=False, default=False)
+    minutos_extras = db.Column(db.Integer, nullable=False, default=0)  # além da jornada diária (CLT)
+    observacao = db.Column(db.Text)
+    atualizado_em = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
+    funcionario = db.relationship("Funcionario", backref=db.backref("ponto_diario", lazy=True, passive_deletes=True))
+    __table_args__ = (
+        db.UniqueConstraint("funcionario_id", "data", name="uq_ponto_diario_func_data"),
+        db.Index("ix_ponto_diario_estab_data", "estabelecimento_id", "data"),
+    )
+
+
 class ConfiguracaoHorario(db.Model, MultiTenantMixin):
     __tablename__ = "configuracoes_horario"
     id = db.Column(db.Integer, primary_key=True)
@@ -2191,6 +2781,7 @@ class Auditoria(db.Model, MultiTenantMixin):
     detalhes_json = db.Column(db.JSON, nullable=True)
     data_evento = db.Column(db.DateTime, default=utcnow)
     estabelecimento = db.relationship("Estabelecimento", backref=db.backref("auditoria", lazy=True, cascade="all, delete-orphan"))
+    __table_args__ = (db.Index("ix_auditoria_estab_data_tipo", "estabelecimento_id", "data_evento", "tipo_evento"),)
     usuario = db.relationship("Funcionario", backref=db.backref("atividades", lazy=True))
 
     def to_dict(self):
@@ -2487,7 +3078,17 @@ class Entrega(db.Model, MultiTenantMixin, SoftDeleteMixin):
     rastreamentos = db.relationship("RastreamentoEntrega", backref="entrega", lazy=True, cascade="all, delete-orphan")
     __table_args__ = (db.Index("ix_entrega_codigo", "codigo_rastreamento"), db.Index("ix_entrega_status", "status"),
                       db.Index("ix_entrega_data_prevista", "data_prevista"), db.Index("ix_entrega_bairro", "endereco_bairro"),
-                      db.Index("ix_entrega_motorista", "motorista_id"))
+                      db.Index("ix_entrega_motorista", "motorista_id"),
+                      db.Index("ix_entrega_estab_created_status", "estabelecimento_id", "created_at", "status"))
+
+    @hybrid_property
+    def data_referencia(self):
+        return self.data_entrega or self.data_saida or self.created_at
+
+    @data_referencia.expression
+    def data_referencia(cls):
+        """Data do período nos relatórios: conclusão, senão saída, senão criação."""
+        return func.coalesce(cls.data_entrega, cls.data_saida, cls.created_at)
 
     def to_dict(self):
         return {"id": self.id, "codigo_rastreamento": self.codigo_rastreamento, "venda_id": self.venda_id,
@@ -2512,6 +3113,11 @@ class Entrega(db.Model, MultiTenantMixin, SoftDeleteMixin):
                 "tempo_estimado_minutos": self.tempo_estimado_minutos, "tempo_real_minutos": self.tempo_real_minutos,
                 "nota_cliente": self.nota_cliente, "observacoes": self.observacoes}
 
+# Índice de expressão: o filtro de período por data_referencia usa a mesma
+# expressão COALESCE, então continua sargável por tenant + data.
+db.Index("ix_entrega_estab_data_ref", Entrega.estabelecimento_id, Entrega.data_referencia)
+
+
 class EntregaItem(db.Model):
     __tablename__ = "entrega_itens"
     id = db.Column(db.Integer, primary_key=True)
@@ -29,6 +29,8 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 import traceback
 
+import json
+
 import pytz
 
 import hashlib
@@ -42,6 +44,55 @@ import os
 auth_bp = Blueprint("auth", __name__)
 
 
+def _contexto_funcionario(funcionario_id):
+    """(funcionario_data, estabelecimento_data) em UMA consulta cacheada.
+
+    Se o schema do banco divergir do modelo (base antiga sem alguma coluna),
+    cai para os helpers get_*_safe, que buscam coluna a coluna.
+    """
+    from app.services.auth_service import AuthService
+
+    try:
+        ctx = AuthService.contexto(funcionario_id)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f"[AUTH] Contexto rápido indisponível, usando fallback safe: {e}")
+        from app.utils.query_helpers import get_funcionario_safe, get_estabelecimento_safe
+        funcionario_data = get_funcionario_safe(funcionario_id)
+        if not funcionario_data:
+            return None, None
+        return funcionario_data, get_estabelecimento_safe(funcionario_data.get("estabelecimento_id"))
+
+    if not ctx:
+        return None, None
+
+    funcionario_data = {k: v for k, v in ctx.items() if not k.startswith("estab_")}
+    try:
+        funcionario_data["permissoes"] = json.loads(ctx["permissoes_json"]) if ctx.get("permissoes_json") else None
+    except (TypeError, ValueError):
+        funcionario_data["permissoes"] = None
+    if funcionario_data["permissoes"] is None:
+        funcionario_data["permissoes"] = {
+            "pdv": True, "estoque": True, "compras": False, "financeiro": False, "configuracoes": False
+        }
+
+    estabelecimento_data = None
+    if ctx.get("estab_nome") is not None:
+        estabelecimento_data = {
+            "id": ctx["estabelecimento_id"],
+            "nome_fantasia": ctx["estab_nome"],
+            "cnpj": ctx["estab_cnpj"],
+            "telefone": ctx["estab_telefone"],
+            "email": ctx["estab_email"],
+            "logradouro": ctx["estab_logradouro"],
+            "cidade": ctx["estab_cidade"],
+            "estado": ctx["estab_estado"],
+            "plano": ctx["estab_plano"] or "Gratuito",
+            "plano_status": ctx["estab_plano_status"] or "experimental",
+        }
+    return funcionario_data, estabelecimento_data
+
+
 
 
 
@@ -517,65 +568,61 @@ def login():
 
 
 
-        funcionario = db.session.execute(
-
-            db.select(Funcionario).filter(
-
-                db.or_( 
-
-                    db.func.lower(Funcionario.username) == identifier.lower(),
-
-                    db.func.lower(Funcionario.email) == identifier.lower(),
-
-                )
-
-            )
-
-        ).scalar_one_or_none()
+        # Funcionário + estabelecimento + plano em UMA consulta
+        from app.services.auth_service import AuthService, registrar_login
 
+        funcionario = AuthService.buscar_para_login(identifier)
 
+        evento = {
+            "username": identifier,
+            "ip_address": request.remote_addr,
+            "user_agent": request.headers.get("User-Agent", "Desconhecido"),
+            "success": False,
+        }
 
         if not funcionario:
-
+            registrar_login({**evento, "observacoes": "Usuário não encontrado"})
             return jsonify({"success": False, "error": "Usuario nao encontrado", "code": "USER_NOT_FOUND"}), 401
 
-        
-
-        if not funcionario.check_senha(senha):
+        evento.update({
+            "funcionario_id": funcionario["id"],
+            "username": funcionario["username"],
+            "estabelecimento_id": funcionario["estabelecimento_id"],
+            "role": funcionario["role"],
+        })
 
+        # PBKDF2 no pool de CPU limitado (não satura as threads do worker na troca de turno)
+        if not AuthService.verificar_senha(funcionario["senha"], senha):
+            registrar_login({**evento, "observacoes": "Senha incorreta"})
             return jsonify({"success": False, "error": "Senha incorreta", "code": "WRONG_PASSWORD"}), 401
 
 
 
-        if not funcionario.ativo or funcionario.status != "ativo":
+        if not funcionario["ativo"] or funcionario["status"] != "ativo":
 
             return jsonify({"success": False, "error": "Conta inativa", "code": "ACCOUNT_INACTIVE"}), 403
 
 
 
-        # Buscar plano do estabelecimento para controle SaaS
-
-        from app.models import Estabelecimento
-
-        estabelecimento = Estabelecimento.query.get(funcionario.estabelecimento_id)
-
-        plano_estabelecimento = estabelecimento.plano if estabelecimento else "Gratuito"
+        # Plano do estabelecimento para controle SaaS (já veio no JOIN)
+        tem_estabelecimento = funcionario["estab_nome"] is not None
+        plano_estabelecimento = funcionario["estab_plano"] if tem_estabelecimento else "Gratuito"
 
         
 
         additional_claims = {
 
-            "username": funcionario.username,
+            "username": funcionario["username"],
 
-            "nome": funcionario.nome,
+            "nome": funcionario["nome"],
 
-            "estabelecimento_id": funcionario.estabelecimento_id,
+            "estabelecimento_id": funcionario["estabelecimento_id"],
 
-            "role": funcionario.role,
+            "role": funcionario["role"],
 
             "status": "ativo",
 
-            "is_super_admin": bool(funcionario.is_super_admin),
+            "is_super_admin": bool(funcionario["is_super_admin"]),
 
             "plano": plano_estabelecimento,  # 🎯 PLANO SaaS para controle de acesso
 
@@ -585,26 +632,14 @@ def login():
 
 
 
-        identity = str(funcionario.id)
+        identity = str(funcionario["id"])
 
         access_token = create_access_token(identity=identity, additional_claims=additional_claims, expires_delta=timedelta(hours=24))
 
         refresh_token = create_refresh_token(identity=identity, additional_claims=additional_claims, expires_delta=timedelta(days=7))
 
-        # Auditoria de login bem-sucedido
-        try:
-            if funcionario.estabelecimento_id:
-                from app.models import Auditoria
-                Auditoria.registrar(
-                    estabelecimento_id=funcionario.estabelecimento_id,
-                    tipo_evento="login",
-                    descricao=f"Login de {funcionario.username} ({funcionario.role})",
-                    usuario_id=funcionario.id,
-                )
-                db.session.commit()
-        except Exception as _audit_err:
-            current_app.logger.warning(f"[AUDIT] Falha ao registrar login: {_audit_err}")
-            db.session.rollback()
+        # Histórico + auditoria de login: gravados em lote pelo writer em background
+        registrar_login({**evento, "success": True, "observacoes": "Login realizado"})
 
         return jsonify({
 
@@ -618,33 +653,29 @@ def login():
 
                 "user": {
 
-                    "id": funcionario.id,
+                    "id": funcionario["id"],
 
-                    "username": funcionario.username,
+                    "username": funcionario["username"],
 
-                    "nome": funcionario.nome,
+                    "nome": funcionario["nome"],
 
-                    "email": funcionario.email,
+                    "email": funcionario["email"],
 
-                    "role": funcionario.role,
+                    "role": funcionario["role"],
 
-                    "cargo": getattr(funcionario, 'cargo', 'Funcionário'),
+                    "cargo": funcionario["cargo"] or 'Funcionário',
 
-                    "status": getattr(funcionario, 'status', 'ativo'),
+                    "status": funcionario["status"] or 'ativo',
 
-                    "is_super_admin": bool(funcionario.is_super_admin),
+                    "is_super_admin": bool(funcionario["is_super_admin"]),
 
-                    "estabelecimento_id": funcionario.estabelecimento_id,
+                    "estabelecimento_id": funcionario["estabelecimento_id"],
 
                     "plano": plano_estabelecimento,
 
-                    "plano_status": getattr(estabelecimento, 'plano_status', 'ativo') if estabelecimento else 'ativo',
+                    "plano_status": (funcionario["estab_plano_status"] or 'ativo') if tem_estabelecimento else 'ativo',
 
-                    "permissoes": getattr(funcionario, 'permissoes_json', {}) if hasattr(funcionario, 'permissoes_json') else {
-
-                        "pdv": True, "estoque": True, "vendas": True, "clientes": True, "financeiro": False, "configuracoes": False
-
-                    }
+                    "permissoes": funcionario["permissoes_json"]
 
                 }
 
@@ -1116,11 +1147,9 @@ def validate_token():
 
 
 
-        # Buscar funcionário de forma safe
+        # Funcionário + estabelecimento: UMA consulta, cacheada por TTL curto
 
-        from app.utils.query_helpers import get_funcionario_safe, get_estabelecimento_safe
-
-        funcionario_data = get_funcionario_safe(int(current_user_id))
+        funcionario_data, _ = _contexto_funcionario(int(current_user_id))
 
 
 
@@ -1174,12 +1203,6 @@ def validate_token():
 
 
 
-        # Buscar informações do estabelecimento de forma safe
-
-        estabelecimento_data = get_estabelecimento_safe(funcionario_data.get("estabelecimento_id"))
-
-
-
         # Usar dados do token e do banco
 
         user_data = {
@@ -1406,9 +1429,7 @@ def get_profile():
 
 
 
-        from app.utils.query_helpers import get_funcionario_safe, get_estabelecimento_safe
-
-        funcionario_data = get_funcionario_safe(int(current_user_id))
+        funcionario_data, estabelecimento_data = _contexto_funcionario(int(current_user_id))
 
 
 
@@ -1436,7 +1457,6 @@ def get_profile():
 
 
 
-        estabelecimento_data = get_estabelecimento_safe(funcionario_data.get("estabelecimento_id"))
 
 
 
@@ -1706,6 +1726,9 @@ def update_profile():
 
         db.session.commit()
 
+        from app.services.auth_service import AuthService
+        AuthService.invalidar(int(current_user_id))
+
 
 
         return (
@@ -6,7 +6,6 @@ Autenticação global com redirecionamento para banco do tenant
 
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt, get_jwt_identity
-from werkzeug.security import check_password_hash
 from datetime import timedelta
 import psycopg2
 import os
@@ -16,12 +15,18 @@ from app.middleware.multi_tenant import tenant_manager
 from app import db
 from app.models import Funcionario, Estabelecimento
 from app.middleware.rate_limit import limiter
+from app.services.auth_service import AuthService, registrar_login
 
 auth_bp = Blueprint('auth_multi_tenant', __name__)
 
 def get_main_connection():
-    """Obtém conexão com banco principal de autenticação"""
+    """Obtém conexão com banco principal de autenticação (None se não configurado).
+
+    Sem MAIN_DATABASE_URL, psycopg2.connect(None) tentava o socket local a cada
+    login só para falhar e cair no banco local — uma ida e volta perdida por request."""
     main_url = os.getenv('MAIN_DATABASE_URL')
+    if not main_url:
+        return None
     return psycopg2.connect(main_url)
 
 def normalize_plan_name(p):
@@ -116,26 +121,26 @@ def bootstrap_admin():
             "message": str(e)
         }), 500
 
-def _auditar_login(estabelecimento_id, usuario_id, username, contexto):
-    """Registra um evento de login na auditoria do tenant (para o monitor do super admin).
-    Nunca quebra o login: falhas são apenas logadas. Super admin / 'all' não geram log de tenant."""
+def _auditar_login(estabelecimento_id, usuario_id, username, contexto, sucesso=True, role=None):
+    """Enfileira o evento de login (login_history + auditoria do tenant, para o
+    monitor do super admin). Gravado em lote pelo writer em background: não
+    segura a resposta nem quebra o login. Super admin / 'all' não gera log de tenant."""
     try:
-        if not estabelecimento_id or str(estabelecimento_id).lower() == "all":
-            return
-        from app.models import Auditoria
-        Auditoria.registrar(
-            estabelecimento_id=int(estabelecimento_id),
-            tipo_evento="login",
-            descricao=f"Login realizado por {username}",
-            usuario_id=usuario_id,
-            detalhes={"contexto": contexto},
-        )
-        db.session.commit()
+        estab_id = None
+        if estabelecimento_id and str(estabelecimento_id).lower() != "all":
+            estab_id = int(estabelecimento_id)
+        registrar_login({
+            "funcionario_id": usuario_id,
+            "username": username,
+            "estabelecimento_id": estab_id,
+            "role": role,
+            "ip_address": request.remote_addr,
+            "user_agent": request.headers.get("User-Agent", "Desconhecido"),
+            "success": sucesso,
+            "contexto": contexto,
+            "observacoes": f"Login ({contexto})" if sucesso else f"Falha de login ({contexto})",
+        })
     except Exception as e:
-        try:
-            db.session.rollback()
-        except Exception:
-            pass
         current_app.logger.warning(f"[AUDIT] Falha ao registrar login de {username}: {e}")
 
 
@@ -182,35 +187,33 @@ def login():
         
         # 2. SEGUNDA TENTATIVA: BANCO LOCAL (SQLITE) - ESSENCIAL PARA SIMULAÇÃO E DESENVOLVIMENTO
         if not all_matches:
-            funcionario_local = Funcionario.query.filter(
-                db.or_(
-                    db.func.lower(Funcionario.username) == username.lower(),
-                    db.func.lower(Funcionario.email) == username.lower()
-                ),
-                Funcionario.ativo == True
-            ).first()
-
-            if funcionario_local and funcionario_local.check_password(senha):
-                estab = funcionario_local.estabelecimento
-                is_super = bool(funcionario_local.is_super_admin)
+            # Funcionário + estabelecimento + plano em UMA consulta; PBKDF2 no pool limitado
+            funcionario_local = AuthService.buscar_para_login(username, apenas_ativos=True)
+
+            if funcionario_local and AuthService.verificar_senha(funcionario_local["senha"], senha):
+                tem_estab = funcionario_local["estab_nome"] is not None
+                is_super = bool(funcionario_local["is_super_admin"])
+                plano = normalize_plan_name(funcionario_local["estab_plano"]) if tem_estab else 'Gratuito'
+                plano_status = funcionario_local["estab_plano_status"] if tem_estab else 'ativo'
                 
                 additional_claims = {
-                    'role': (funcionario_local.role or 'FUNCIONARIO').upper(),
+                    'role': (funcionario_local["role"] or 'FUNCIONARIO').upper(),
                     'status': 'ativo',
                     'is_super_admin': is_super,
-                    'estabelecimento_id': "all" if is_super else (funcionario_local.estabelecimento_id or "all"),
-                    'estabelecimento_nome': estab.nome_fantasia if estab else "MercadinhoSys",
+                    'estabelecimento_id': "all" if is_super else (funcionario_local["estabelecimento_id"] or "all"),
+                    'estabelecimento_nome': funcionario_local["estab_nome"] if tem_estab else "MercadinhoSys",
                     'database_name': 'local',
-                    'user_id': funcionario_local.id,
-                    'plano': normalize_plan_name(estab.plano) if estab else 'Gratuito',
-                    'plano_status': estab.plano_status if estab else 'ativo'
+                    'user_id': funcionario_local["id"],
+                    'plano': plano,
+                    'plano_status': plano_status
                 }
                 
-                identity = str(funcionario_local.id)
+                identity = str(funcionario_local["id"])
                 access_token = create_access_token(identity=identity, additional_claims=additional_claims, expires_delta=timedelta(hours=24))
                 refresh_token = create_refresh_token(identity=identity, additional_claims=additional_claims)
 
-                _auditar_login(funcionario_local.estabelecimento_id, funcionario_local.id, username, "local")
+                _auditar_login(funcionario_local["estabelecimento_id"], funcionario_local["id"], username, "local",
+                               role=funcionario_local["role"])
 
                 return jsonify({
                     'success': True,
@@ -218,21 +221,26 @@ def login():
                     'refresh_token': refresh_token,
                     'data': {
                         'user': {
-                            'id': funcionario_local.id,
-                            'nome': funcionario_local.nome,
-                            'email': funcionario_local.email,
-                            'role': funcionario_local.role,
-                            'cargo': getattr(funcionario_local, 'cargo', 'Administrador'),
+                            'id': funcionario_local["id"],
+                            'nome': funcionario_local["nome"],
+                            'email': funcionario_local["email"],
+                            'role': funcionario_local["role"],
+                            'cargo': funcionario_local["cargo"] or 'Administrador',
                             'is_super_admin': is_super,
-                            'estabelecimento_id': "all" if is_super else funcionario_local.estabelecimento_id,
-                            'plano': normalize_plan_name(estab.plano) if estab else 'Gratuito',
-                            'plano_status': estab.plano_status if estab else 'ativo',
-                            'permissoes': funcionario_local.permissoes
+                            'estabelecimento_id': "all" if is_super else funcionario_local["estabelecimento_id"],
+                            'plano': plano,
+                            'plano_status': plano_status,
+                            'permissoes': funcionario_local["permissoes"]
                         }
                     },
                     'message': 'Login realizado com sucesso (Contexto Local)'
                 }), 200
             
+            _auditar_login(
+                funcionario_local["estabelecimento_id"] if funcionario_local else None,
+                funcionario_local["id"] if funcionario_local else None,
+                username, "local", sucesso=False,
+            )
             return jsonify({'success': False, 'error': 'Usuário ou senha inválidos'}), 401
         
         # 3. PROCESSAR RESULTADO CLOUD
@@ -241,7 +249,8 @@ def login():
          estabelecimento_nome, database_name, estabelecimento_status, razao_social, cnpj, is_super_db,
          plano_estab, plano_status_estab) = user_data
         
-        if not check_password_hash(senha_val, senha):
+        if not AuthService.verificar_senha(senha_val, senha):
+            _auditar_login(estabelecimento_id, user_id, username, "cloud", sucesso=False)
             return jsonify({'success': False, 'error': 'Usuário ou senha inválidos'}), 401
         
         is_super = bool(is_super_db)
@@ -270,7 +279,7 @@ def login():
             additional_claims=additional_claims
         )
 
-        _auditar_login(estabelecimento_id, user_id, username, "cloud")
+        _auditar_login(estabelecimento_id, user_id, username, "cloud", role=role)
 
         return jsonify({
             'success': True,
@@ -362,33 +371,34 @@ def get_current_user():
         user_data = None
         try:
             conn = get_main_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT f.id, f.nome, f.email, f.role, f.estabelecimento_id,
-                       e.nome_fantasia, e.razao_social, e.cnpj, e.plano, e.plano_status
-                FROM public.funcionarios f
-                JOIN public.estabelecimentos e ON f.estabelecimento_id = e.id
-                WHERE f.id = %s AND f.ativo = true
-            """, (user_id,))
-            user_data = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            if conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT f.id, f.nome, f.email, f.role, f.estabelecimento_id,
+                           e.nome_fantasia, e.razao_social, e.cnpj, e.plano, e.plano_status
+                    FROM public.funcionarios f
+                    JOIN public.estabelecimentos e ON f.estabelecimento_id = e.id
+                    WHERE f.id = %s AND f.ativo = true
+                """, (user_id,))
+                user_data = cursor.fetchone()
+                cursor.close()
+                conn.close()
         except Exception:
             pass
             
         # --- TENTATIVA 2: BANCO LOCAL (SQLITE FALLBACK) ---
+        # Funcionário + estabelecimento numa consulta, cacheada por TTL curto
         if not user_data:
-            from app.models import Funcionario
-            f = Funcionario.query.get(int(user_id))
+            f = AuthService.contexto(int(user_id))
             if f:
-                estab = f.estabelecimento
+                tem_estab = f["estab_nome"] is not None
                 user_data = (
-                    f.id, f.nome, f.email, f.role, f.estabelecimento_id,
-                    estab.nome_fantasia if estab else "MercadinhoSys",
-                    estab.razao_social if estab else "",
-                    estab.cnpj if estab else "",
-                    estab.plano if estab else "Gratuito",
-                    estab.plano_status if estab else "ativo"
+                    f["id"], f["nome"], f["email"], f["role"], f["estabelecimento_id"],
+                    f["estab_nome"] if tem_estab else "MercadinhoSys",
+                    f["estab_razao_social"] if tem_estab else "",
+                    f["estab_cnpj"] if tem_estab else "",
+                    f["estab_plano"] if tem_estab else "Gratuito",
+                    f["estab_plano_status"] if tem_estab else "ativo"
                 )
         
         if not user_data:
@@ -709,6 +719,7 @@ def update_profile():
             atualizados.append("senha")
 
         db.session.commit()
+        AuthService.invalidar(funcionario.id)
         return jsonify({
             "success": True,
             "message": "Perfil atualizado com sucesso",
@@ -4,6 +4,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.decorators.plan_guards import permission_required
 from app import db
 from app.models import Caixa, MovimentacaoCaixa, Estabelecimento, Funcionario, Auditoria
+from app.services.caixa_service import CaixaService
 
 caixas_bp = Blueprint("caixas", __name__)
 
@@ -130,25 +131,11 @@ def fechar_caixa():
         # Entradas = Vendas (todas) + Suprimentos
         # Saídas = Sangrias
         
-        movimentacoes = MovimentacaoCaixa.query.filter_by(caixa_id=caixa.id).all()
-        from collections import defaultdict
-        totais_por_forma = defaultdict(lambda: {"quantidade": 0, "total": 0.0})
-        total_sangrias = 0.0
-        total_suprimentos = 0.0
-        total_vendas = 0.0
-
-        for m in movimentacoes:
-            valor_mov = float(m.valor or 0)
-            tipo_mov = m.tipo.lower()
-            if tipo_mov == "venda":
-                forma = str(m.forma_pagamento or "outros").lower()
-                totais_por_forma[forma]["quantidade"] += 1
-                totais_por_forma[forma]["total"] += valor_mov
-                total_vendas += valor_mov
-            elif tipo_mov == "sangria":
-                total_sangrias += valor_mov
-            elif tipo_mov == "suprimento":
-                total_suprimentos += valor_mov
+        # Totais correntes do turno (caixa_totais), sem varrer o livro de movimentações.
+        totais = CaixaService.totais(caixa.id)
+        totais_por_forma = totais["por_forma_pagamento"]
+        total_sangrias = totais["total_sangrias"]
+        total_suprimentos = totais["total_suprimentos"]
 
         # ─── Cálculo Final do Dinheiro (Gaveta Física) ───
         # Apenas as vendas em dinheiro entram no cálculo físico da gaveta
@@ -204,7 +191,7 @@ def fechar_caixa():
                 "saidas": round(saidas, 2),
                 "saldo_final": round(saldo_calculado, 2),
                 "quebra_gaveta": round(diferenca_gaveta, 2),
-                "por_forma_pagamento": dict(totais_por_forma)
+                "por_forma_pagamento": totais_por_forma
             }
         }), 200
 
@@ -245,8 +232,15 @@ def registrar_movimentacao():
         # Regra de Acesso: SANGRIA exige o PIN de segurança da loja (conferência
         # do valor exato junto com o caixa). Suprimento não exige.
         if tipo == "sangria":
-            from app.routes.configuracao import autorizar_por_pin
-            autorizador = autorizar_por_pin(caixa.estabelecimento_id, data.get("pin"))
+            from app.services.pin_service import PinBloqueado, PinService, origem_da_requisicao
+            try:
+                autorizador = PinService.autorizar(caixa.estabelecimento_id, data.get("pin"),
+                                                   origem=origem_da_requisicao(caixa.estabelecimento_id, caixa.id))
+            except PinBloqueado as e:
+                resp = jsonify({"success": False, "error": str(e), "code": "PIN_BLOQUEADO",
+                                "retry_after": e.retry_after})
+                resp.headers["Retry-After"] = str(e.retry_after)
+                return resp, 429
             if not autorizador:
                 return jsonify({
                     "success": False,
@@ -292,7 +286,13 @@ def registrar_movimentacao():
 @caixas_bp.route("/atual/movimentacoes", methods=["GET"])
 @jwt_required()
 def obter_movimentacoes_caixa_atual():
-    """Retorna as movimentações do caixa atualmente aberto para o funcionário logado"""
+    """Retorna as movimentações do caixa aberto do funcionário logado, paginadas
+    por cursor (mais recentes primeiro).
+
+    Query params:
+    - limite: itens por página (default 100, máx. 500)
+    - antes_de: cursor (id da última movimentação recebida)
+    """
     try:
         user_id = int(get_jwt_identity())
         
@@ -304,13 +304,27 @@ def obter_movimentacoes_caixa_atual():
         if not caixa:
             return jsonify({"success": False, "error": "Nenhum caixa aberto encontrado"}), 404
 
-        movimentacoes = MovimentacaoCaixa.query.filter_by(
-            caixa_id=caixa.id
-        ).order_by(MovimentacaoCaixa.created_at.desc()).all()
+        limite = min(max(request.args.get("limite", 100, type=int), 1), 500)
+        antes_de = request.args.get("antes_de", type=int)
+
+        # Keyset pagination pelo id (ix_mov_caixa_caixa): custo por página
+        # constante, sem OFFSET nem COUNT sobre o turno inteiro.
+        query = MovimentacaoCaixa.query.filter_by(caixa_id=caixa.id)
+        if antes_de:
+            query = query.filter(MovimentacaoCaixa.id < antes_de)
+        movimentacoes = query.order_by(MovimentacaoCaixa.id.desc()).limit(limite + 1).all()
+
+        tem_proxima = len(movimentacoes) > limite
+        movimentacoes = movimentacoes[:limite]
 
         return jsonify({
             "success": True, 
-            "data": [mov.to_dict() for mov in movimentacoes]
+            "data": [mov.to_dict() for mov in movimentacoes],
+            "paginacao": {
+                "limite": limite,
+                "tem_proxima": tem_proxima,
+                "proximo_cursor": movimentacoes[-1].id if tem_proxima else None,
+            },
         }), 200
     except Exception as e:
         current_app.logger.error(f"Erro ao obter movimentações do caixa: {e}", exc_info=True)
@@ -332,69 +346,10 @@ def obter_resumo_caixa_atual():
         if not caixa:
             return jsonify({"success": False, "error": "Nenhum caixa aberto encontrado"}), 404
 
-        from app.models import MovimentacaoCaixa
-        from collections import defaultdict
-
-        # ─── Normalização de formas de pagamento ──────────────────────────────
-        NORMALIZE_MAP = {
-            "dinheiro": "dinheiro",
-            "cartao_credito": "cartao_credito",
-            "cartao_debito": "cartao_debito",
-            "pix": "pix",
-            "fiado": "fiado",
-            "outros": "outros",
-        }
-
-        def normalizar_forma(forma_raw: str) -> str:
-            if not forma_raw: return "outros"
-            # Remove acentos, espaços e converte para minúsculo
-            key = str(forma_raw).strip().lower()
-            key = key.replace("é", "e").replace("ê", "e").replace("ã", "a").replace("á", "a")
-            
-            if "credito" in key: return "cartao_credito"
-            if "debito" in key: return "cartao_debito"
-            if "pix" in key: return "pix"
-            if "dinheiro" in key: return "dinheiro"
-            if "fiado" in key: return "fiado"
-            
-            return "outros"
-
-        # Buscar todas as movimentações do caixa atual
-        movimentacoes = MovimentacaoCaixa.query.filter_by(caixa_id=caixa.id).all()
-        
-        totais_por_forma = defaultdict(lambda: {"quantidade": 0, "total": 0.0})
-        
-        # Inicializar formas fixas
-        FORMAS_FIXAS = ["dinheiro", "cartao_debito", "cartao_credito", "pix", "fiado"]
-        for f in FORMAS_FIXAS: totais_por_forma[f]
-
-        total_sangrias = 0.0
-        total_suprimentos = 0.0
-        total_vendas = 0.0
-
-        for m in movimentacoes:
-            valor = float(m.valor or 0)
-            tipo = m.tipo.lower()
-            
-            if tipo == "venda":
-                forma = normalizar_forma(m.forma_pagamento)
-                totais_por_forma[forma]["quantidade"] += 1
-                totais_por_forma[forma]["total"] += valor
-                total_vendas += valor
-            elif tipo == "sangria":
-                total_sangrias += valor
-            elif tipo == "suprimento":
-                total_suprimentos += valor
-            # 'abertura' e 'fechamento' não entram no cálculo de vendas/sangrias/suprimentos fixos
-
-        # Saldo esperado na gaveta (Dinheiro Inicial + Vendas Dinheiro + Suprimentos - Sangrias)
-        vendas_dinheiro = totais_por_forma["dinheiro"]["total"]
-        saldo_esperado_gaveta = (
-            float(caixa.saldo_inicial or 0) 
-            + vendas_dinheiro 
-            + total_suprimentos 
-            - total_sangrias
-        )
+        # Totais correntes (caixa_totais): custo constante, independente do
+        # número de movimentações do turno.
+        totais = CaixaService.totais(caixa.id)
+        saldo_esperado_gaveta = CaixaService.saldo_esperado_gaveta(caixa, totais)
 
         return jsonify({
             "success": True,
@@ -403,13 +358,49 @@ def obter_resumo_caixa_atual():
                 "saldo_inicial": float(caixa.saldo_inicial or 0),
                 "saldo_atual": float(caixa.saldo_atual or 0),
                 "saldo_esperado_gaveta": round(saldo_esperado_gaveta, 2),
-                "total_vendas": round(total_vendas, 2),
-                "total_sangrias": round(total_sangrias, 2),
-                "total_suprimentos": round(total_suprimentos, 2),
-                "por_forma_pagamento": dict(totais_por_forma),
+                "total_vendas": round(totais["total_vendas"], 2),
+                "total_sangrias": round(totais["total_sangrias"], 2),
+                "total_suprimentos": round(totais["total_suprimentos"], 2),
+                "por_forma_pagamento": totais["por_forma_pagamento"],
                 "data_abertura": caixa.data_abertura.isoformat() if caixa.data_abertura else None,
             }
         }), 200
     except Exception as e:
         current_app.logger.error(f"Erro ao obter resumo do caixa: {e}", exc_info=True)
         return jsonify({"success": False, "error": str(e)}), 500
+
+
+@caixas_bp.route("/atual/reconciliacao", methods=["GET"])
+@jwt_required()
+@permission_required('gestao_caixa')
+def reconciliar_caixa_atual():
+    """Confere os totais correntes do caixa aberto contra o livro de movimentações (só leitura)."""
+    return _reconciliar_caixa_atual(corrigir=False)
+
+
+@caixas_bp.route("/atual/reconciliacao", methods=["POST"])
+@jwt_required()
+@permission_required('gestao_caixa')
+def corrigir_caixa_atual():
+    """Reconstrói os totais correntes do caixa aberto a partir do livro se houver divergência."""
+    return _reconciliar_caixa_atual(corrigir=True)
+
+
+def _reconciliar_caixa_atual(corrigir: bool):
+    try:
+        user_id = int(get_jwt_identity())
+
+        caixa = Caixa.query.filter_by(
+            funcionario_id=user_id,
+            status="aberto"
+        ).order_by(Caixa.data_abertura.desc()).first()
+
+        if not caixa:
+            return jsonify({"success": False, "error": "Nenhum caixa aberto encontrado"}), 404
+
+        resultado = CaixaService.reconciliar(caixa.id, corrigir=corrigir)
+        return jsonify({"success": True, "data": {"caixa_id": caixa.id, **resultado}}), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erro ao reconciliar caixa: {e}", exc_info=True)
+        return jsonify({"success": False, "error": str(e)}), 500
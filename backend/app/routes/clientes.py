@@ -15,6 +15,9 @@ import re
 from app.models import db, Cliente, Estabelecimento, Venda, VendaItem, ContaReceber, Funcionario
 from app.utils import validar_cpf, validar_email, formatar_telefone, calcular_idade
 from app.utils.ia_copiloto import gerar_texto, ia_disponivel
+from app.services.rfm_service import RFMService
+from app.services.exportacao_service import Coluna, Exportacao, registrar_exportacao, responder
+from app.services.importacao_service import ImportacaoService, resposta as resposta_importacao, responder as responder_importacao
 from app.decorators.decorator_jwt import funcionario_required
 from app.decorators.plan_guards import quota_required, permission_required
 
@@ -149,6 +152,65 @@ def calcular_limite_disponivel(cliente):
     return max(0, limite - saldo_devedor)
 
 
+def aplicar_filtros_clientes(query, args, estabelecimento_id):
+    """Filtros da listagem de clientes (tenant, ativo, classificação, busca).
+
+    Vale para a Query ORM da listagem e para o select só de colunas da
+    exportação."""
+    ativo = args.get("ativo", None, type=str)
+    classificacao = args.get("classificacao", None, type=str)
+    busca = args.get("busca", "", type=str).strip()
+
+    if estabelecimento_id != 'all':
+        query = query.filter(Cliente.estabelecimento_id == estabelecimento_id)
+
+    if ativo is not None:
+        query = query.filter(Cliente.ativo == (ativo.lower() == "true"))
+
+    if classificacao:
+        # Classificação baseada em valor total gasto
+        if classificacao == "PREMIUM":
+            query = query.filter(Cliente.valor_total_gasto > 10000)
+        elif classificacao == "A":
+            query = query.filter(Cliente.valor_total_gasto.between(5000, 10000))
+        elif classificacao == "B":
+            query = query.filter(Cliente.valor_total_gasto.between(1000, 5000))
+        elif classificacao == "C":
+            query = query.filter(Cliente.valor_total_gasto > 0)
+        elif classificacao == "NOVO":
+            query = query.filter(Cliente.total_compras == 0)
+
+    if busca:
+        busca_termo = f"%{busca}%"
+        query = query.filter(
+            db.or_(
+                ilike_unaccent(Cliente.nome, busca_termo),
+                ilike_unaccent(Cliente.cpf, busca_termo),
+                ilike_unaccent(Cliente.email, busca_termo),
+                ilike_unaccent(Cliente.celular, busca_termo),
+                ilike_unaccent(Cliente.telefone, busca_termo),
+            )
+        )
+    return query
+
+
+def ordenar_clientes(query, ordenar_por, direcao):
+    campos_ordenacao = {
+        "id": Cliente.id,
+        "nome": Cliente.nome,
+        "cpf": Cliente.cpf,
+        "valor_total_gasto": Cliente.valor_total_gasto,
+        "total_compras": Cliente.total_compras,
+        "data_cadastro": Cliente.data_cadastro,
+        "ultima_compra": Cliente.ultima_compra,
+    }
+
+    campo_ordenacao = campos_ordenacao.get(ordenar_por, Cliente.nome)
+    if direcao == "desc":
+        return query.order_by(campo_ordenacao.desc())
+    return query.order_by(campo_ordenacao.asc())
+
+
 # ============================================
 # ROTAS DE CLIENTES
 # ============================================
@@ -169,61 +231,11 @@ def listar_clientes():
         pagina = request.args.get("pagina", 1, type=int)
         por_pagina = request.args.get("por_pagina", 50, type=int)
         ativo = request.args.get("ativo", None, type=str)
-        classificacao = request.args.get("classificacao", None, type=str)
-        busca = request.args.get("busca", "", type=str).strip()
         ordenar_por = request.args.get("ordenar_por", "id")
         direcao = request.args.get("direcao", "desc")
 
-        # Query base
-        query = Cliente.query
-        if estabelecimento_id != 'all':
-            query = query.filter_by(estabelecimento_id=estabelecimento_id)
-
-        # Filtros
-        if ativo is not None:
-            query = query.filter_by(ativo=ativo.lower() == "true")
-
-        if classificacao:
-            # Classificação baseada em valor total gasto
-            if classificacao == "PREMIUM":
-                query = query.filter(Cliente.valor_total_gasto > 10000)
-            elif classificacao == "A":
-                query = query.filter(Cliente.valor_total_gasto.between(5000, 10000))
-            elif classificacao == "B":
-                query = query.filter(Cliente.valor_total_gasto.between(1000, 5000))
-            elif classificacao == "C":
-                query = query.filter(Cliente.valor_total_gasto > 0)
-            elif classificacao == "NOVO":
-                query = query.filter(Cliente.total_compras == 0)
-
-        if busca:
-            busca_termo = f"%{busca}%"
-            query = query.filter(
-                db.or_(
-                    ilike_unaccent(Cliente.nome, busca_termo),
-                    ilike_unaccent(Cliente.cpf, busca_termo),
-                    ilike_unaccent(Cliente.email, busca_termo),
-                    ilike_unaccent(Cliente.celular, busca_termo),
-                    ilike_unaccent(Cliente.telefone, busca_termo),
-                )
-            )
-
-        # Ordenação
-        campos_ordenacao = {
-            "id": Cliente.id,
-            "nome": Cliente.nome,
-            "cpf": Cliente.cpf,
-            "valor_total_gasto": Cliente.valor_total_gasto,
-            "total_compras": Cliente.total_compras,
-            "data_cadastro": Cliente.data_cadastro,
-            "ultima_compra": Cliente.ultima_compra,
-        }
-
-        campo_ordenacao = campos_ordenacao.get(ordenar_por, Cliente.nome)
-        if direcao == "desc":
-            query = query.order_by(campo_ordenacao.desc())
-        else:
-            query = query.order_by(campo_ordenacao.asc())
+        query = aplicar_filtros_clientes(Cliente.query, request.args, estabelecimento_id)
+        query = ordenar_clientes(query, ordenar_por, direcao)
 
         # Paginação
         paginacao = query.paginate(page=pagina, per_page=por_pagina, error_out=False)
@@ -1679,237 +1691,84 @@ def listar_produtos_cliente(id):
         return jsonify({"success": False, "message": "Erro interno ao listar produtos"}), 500
 
 
+def _data(valor, formato):
+    return valor.strftime(formato) if valor else ""
+
+
+@registrar_exportacao("clientes")
+def exportacao_clientes(estabelecimento_id, args):
+    """Layout de GET /api/clientes/exportar sobre um select só de colunas."""
+    consulta = db.select(
+        Cliente.id, Cliente.nome, Cliente.cpf, Cliente.rg, Cliente.data_nascimento, Cliente.telefone,
+        Cliente.celular, Cliente.email, Cliente.cep, Cliente.logradouro, Cliente.numero, Cliente.complemento,
+        Cliente.bairro, Cliente.cidade, Cliente.estado, Cliente.pais, Cliente.limite_credito,
+        Cliente.saldo_devedor, Cliente.total_compras, Cliente.valor_total_gasto, Cliente.ultima_compra,
+        Cliente.ativo, Cliente.observacoes, Cliente.data_cadastro, Cliente.data_atualizacao,
+    ).where(Cliente.deleted_at.is_(None))
+    consulta = aplicar_filtros_clientes(consulta, args, estabelecimento_id)
+    consulta = ordenar_clientes(consulta, args.get("ordenar_por", "nome"), args.get("direcao", "asc"))
+    return Exportacao("clientes", consulta, [
+        Coluna("ID", "id"),
+        Coluna("Nome", "nome"),
+        Coluna("CPF", "cpf"),
+        Coluna("RG", "rg"),
+        Coluna("Data Nascimento", lambda c: _data(c.data_nascimento, "%d/%m/%Y")),
+        Coluna("Idade", lambda c: calcular_idade(c.data_nascimento) if c.data_nascimento else ""),
+        Coluna("Telefone", "telefone"),
+        Coluna("Celular", "celular"),
+        Coluna("Email", "email"),
+        Coluna("CEP", "cep"),
+        Coluna("Logradouro", "logradouro"),
+        Coluna("Número", "numero"),
+        Coluna("Complemento", "complemento"),
+        Coluna("Bairro", "bairro"),
+        Coluna("Cidade", "cidade"),
+        Coluna("Estado", "estado"),
+        Coluna("País", "pais"),
+        Coluna("Limite Crédito", lambda c: float(c.limite_credito or 0)),
+        Coluna("Saldo Devedor", lambda c: float(c.saldo_devedor or 0)),
+        Coluna("Limite Disponível", calcular_limite_disponivel),
+        Coluna("Total Compras", lambda c: c.total_compras or 0),
+        Coluna("Valor Total Gasto", lambda c: float(c.valor_total_gasto or 0)),
+        Coluna("Ticket Médio", lambda c: float(c.valor_total_gasto / c.total_compras) if c.total_compras else 0),
+        Coluna("Última Compra", lambda c: _data(c.ultima_compra, "%d/%m/%Y %H:%M")),
+        Coluna("Classificação", calcular_classificacao_cliente),
+        Coluna("Ativo", lambda c: "SIM" if c.ativo else "NÃO"),
+        Coluna("Observações", "observacoes"),
+        Coluna("Data Cadastro", lambda c: _data(c.data_cadastro, "%d/%m/%Y %H:%M:%S")),
+        Coluna("Data Atualização", lambda c: _data(c.data_atualizacao, "%d/%m/%Y %H:%M:%S")),
+    ])
+
+
 @clientes_bp.route("/exportar", methods=["GET"])
 @funcionario_required
 def exportar_clientes():
-    """Exporta clientes em formato CSV ou Excel"""
+    """Exporta clientes em CSV (stream) ou Excel, com os filtros da listagem.
+
+    ?assincrono=true gera o arquivo em background. Sem ?ativo exporta só os
+    ativos, como sempre fez."""
     try:
-        # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
-        
-        formato = request.args.get("formato", "csv", type=str).lower()
-        apenas_ativos = request.args.get("ativo", "true", type=str).lower() == "true"
-
-        # Buscar clientes
-        query = Cliente.query.filter_by(
-            estabelecimento_id=estabelecimento_id
-        )
-
-        if apenas_ativos:
-            query = query.filter_by(ativo=True)
-
-        clientes = query.order_by(Cliente.nome.asc()).all()
-
-        if formato == "csv":
-            # Gerar CSV
-            import csv
-            import io
-
-            output = io.StringIO()
-            writer = csv.writer(output, delimiter=";")
-
-            # Cabeçalho
-            writer.writerow(
-                [
-                    "ID",
-                    "Nome",
-                    "CPF",
-                    "RG",
-                    "Data Nascimento",
-                    "Idade",
-                    "Telefone",
-                    "Celular",
-                    "Email",
-                    "CEP",
-                    "Logradouro",
-                    "Número",
-                    "Complemento",
-                    "Bairro",
-                    "Cidade",
-                    "Estado",
-                    "País",
-                    "Limite Crédito",
-                    "Saldo Devedor",
-                    "Limite Disponível",
-                    "Total Compras",
-                    "Valor Total Gasto",
-                    "Ticket Médio",
-                    "Última Compra",
-                    "Classificação",
-                    "Ativo",
-                    "Observações",
-                    "Data Cadastro",
-                    "Data Atualização",
-                ]
-            )
-
-            # Dados
-            for c in clientes:
-                idade = calcular_idade(c.data_nascimento) if c.data_nascimento else ""
-                classificacao = calcular_classificacao_cliente(c)
-                limite_disponivel = calcular_limite_disponivel(c)
-                ticket_medio = (
-                    float(c.valor_total_gasto / c.total_compras)
-                    if c.total_compras > 0
-                    else 0
-                )
-
-                writer.writerow(
-                    [
-                        c.id,
-                        c.nome or "",
-                        c.cpf or "",
-                        c.rg or "",
-                        (
-                            c.data_nascimento.strftime("%d/%m/%Y")
-                            if c.data_nascimento
-                            else ""
-                        ),
-                        idade,
-                        c.telefone or "",
-                        c.celular or "",
-                        c.email or "",
-                        c.cep or "",
-                        c.logradouro or "",
-                        c.numero or "",
-                        c.complemento or "",
-                        c.bairro or "",
-                        c.cidade or "",
-                        c.estado or "",
-                        c.pais or "",
-                        float(c.limite_credito or 0),
-                        float(c.saldo_devedor or 0),
-                        limite_disponivel,
-                        c.total_compras or 0,
-                        float(c.valor_total_gasto or 0),
-                        ticket_medio,
-                        (
-                            c.ultima_compra.strftime("%d/%m/%Y %H:%M")
-                            if c.ultima_compra
-                            else ""
-                        ),
-                        classificacao,
-                        "SIM" if c.ativo else "NÃO",
-                        c.observacoes or "",
-                        (
-                            c.data_cadastro.strftime("%d/%m/%Y %H:%M:%S")
-                            if c.data_cadastro
-                            else ""
-                        ),
-                        (
-                            c.data_atualizacao.strftime("%d/%m/%Y %H:%M:%S")
-                            if c.data_atualizacao
-                            else ""
-                        ),
-                    ]
-                )
-
-            output.seek(0)
-            return (
-                output.getvalue(),
-                200,
-                {
-                    "Content-Type": "text/csv; charset=utf-8",
-                    "Content-Disposition": "attachment; filename=clientes.csv",
-                },
-            )
-
-        elif formato == "excel":
-            # Gerar Excel
-            import pandas as pd
-
-            dados = []
-            for c in clientes:
-                idade = calcular_idade(c.data_nascimento) if c.data_nascimento else ""
-                classificacao = calcular_classificacao_cliente(c)
-                limite_disponivel = calcular_limite_disponivel(c)
-                ticket_medio = (
-                    float(c.valor_total_gasto / c.total_compras)
-                    if c.total_compras > 0
-                    else 0
-                )
-
-                dados.append(
-                    {
-                        "ID": c.id,
-                        "Nome": c.nome or "",
-                        "CPF": c.cpf or "",
-                        "RG": c.rg or "",
-                        "Data Nascimento": (
-                            c.data_nascimento.strftime("%d/%m/%Y")
-                            if c.data_nascimento
-                            else ""
-                        ),
-                        "Idade": idade,
-                        "Telefone": c.telefone or "",
-                        "Celular": c.celular or "",
-                        "Email": c.email or "",
-                        "CEP": c.cep or "",
-                        "Logradouro": c.logradouro or "",
-                        "Número": c.numero or "",
-                        "Complemento": c.complemento or "",
-                        "Bairro": c.bairro or "",
-                        "Cidade": c.cidade or "",
-                        "Estado": c.estado or "",
-                        "País": c.pais or "",
-                        "Limite Crédito": float(c.limite_credito or 0),
-                        "Saldo Devedor": float(c.saldo_devedor or 0),
-                        "Limite Disponível": limite_disponivel,
-                        "Total Compras": c.total_compras or 0,
-                        "Valor Total Gasto": float(c.valor_total_gasto or 0),
-                        "Ticket Médio": ticket_medio,
-                        "Última Compra": (
-                            c.ultima_compra.strftime("%d/%m/%Y %H:%M")
-                            if c.ultima_compra
-                            else ""
-                        ),
-                        "Classificação": classificacao,
-                        "Ativo": "SIM" if c.ativo else "NÃO",
-                        "Observações": c.observacoes or "",
-                        "Data Cadastro": (
-                            c.data_cadastro.strftime("%d/%m/%Y %H:%M:%S")
-                            if c.data_cadastro
-                            else ""
-                        ),
-                        "Data Atualização": (
-                            c.data_atualizacao.strftime("%d/%m/%Y %H:%M:%S")
-                            if c.data_atualizacao
-                            else ""
-                        ),
-                    }
-                )
-
-            df = pd.DataFrame(dados)
-
-            # Salvar em buffer
-            from io import BytesIO
+        if estabelecimento_id is None:
+            return jsonify({"success": False, "message": "Estabelecimento não identificado"}), 400
 
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                df.to_excel(writer, sheet_name="Clientes", index=False)
+        args = request.args.copy()
+        args.setdefault("ativo", "true")
+        formato = args.get("formato", "csv", type=str).lower()
+        formato = "xlsx" if formato == "excel" else formato
+        return responder("clientes", estabelecimento_id, args, formato, f"clientes.{formato}",
+                         funcionario_id=get_jwt_identity())
 
-            output.seek(0)
-            return (
-                output.getvalue(),
-                200,
+    except ValueError:
+        return (
+            jsonify(
                 {
-                    "Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    "Content-Disposition": "attachment; filename=clientes.xlsx",
-                },
-            )
-
-        else:
-            return (
-                jsonify(
-                    {
-                        "success": False,
-                        "message": 'Formato não suportado. Use "csv" ou "excel"',
-                    }
-                ),
-                400,
-            )
-
+                    "success": False,
+                    "message": 'Formato não suportado. Use "csv" ou "excel"',
+                }
+            ),
+            400,
+        )
     except Exception as e:
         current_app.logger.error(f"Erro ao exportar clientes: {str(e)}")
         return (
@@ -2233,8 +2092,9 @@ def obter_rfm():
     try:
         estabelecimento_id = get_authorized_establishment_id()
         dias = request.args.get("dias", 180, type=int)
-        
-        rfm_data = Cliente.calcular_rfm(estabelecimento_id, days=dias)
+
+        # Lê o snapshot persistido (clientes_rfm); outra janela é calculada na hora, sem gravar.
+        rfm_data = RFMService.resumo_perfis(estabelecimento_id, janela_dias=dias)
         return jsonify({"success": True, "rfm": rfm_data})
     except Exception as e:
         current_app.logger.error(f"Erro ao calcular RFM: {str(e)}")
@@ -2245,128 +2105,49 @@ def obter_rfm():
 @permission_required('clientes')
 def importar_clientes_csv():
     """
-    Importa clientes em massa via CSV.
+    Importa clientes em massa via CSV (job em background; ver importacao_service).
     Permissao: ADMIN ou GERENTE (via permission_required).
     Processa saldo devedor inicial para migração de fiado.
+    Form/query: arquivo (CSV), simular=true (só valida e conta), atualizar=true
+    (CPFs já cadastrados têm o cadastro atualizado em vez de rejeitados).
     """
-    import csv
-    import io
-    from decimal import Decimal
-    
     try:
-        jwt_data = get_jwt()
         estabelecimento_id = get_authorized_establishment_id()
-        
+
         if 'arquivo' not in request.files:
             return jsonify({"success": False, "message": "Nenhum arquivo enviado"}), 400
-        
+
         file = request.files['arquivo']
-        if file.filename == '' or not file.filename.endswith('.csv'):
+        if file.filename == '' or not file.filename.lower().endswith('.csv'):
             return jsonify({"success": False, "message": "O arquivo deve ser um CSV"}), 400
 
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-        reader = csv.DictReader(stream, delimiter=';')
-        
-        if not reader.fieldnames or len(reader.fieldnames) < 2:
-            stream.seek(0)
-            reader = csv.DictReader(stream, delimiter=',')
-            
-        success_count = 0
-        error_count = 0
-        errors = []
-        
-        for row_idx, row in enumerate(reader, start=1):
-            try:
-                nome = row.get('nome', '').strip()
-                cpf = row.get('cpf', '').strip()
-                celular = row.get('celular', '').strip()
-                limite_str = row.get('limite_credito', '0').replace(',', '.')
-                saldo_str = row.get('saldo_devedor', '0').replace(',', '.')
-                
-                if not nome:
-                    errors.append(f"Linha {row_idx}: Nome é obrigatório")
-                    error_count += 1
-                    continue
-                
-                cpf_formatado = formatar_cpf(cpf) if cpf else None
-                celular_formatado = formatar_telefone(celular) if celular else None
-                
-                # Check for existing CPF
-                if cpf_formatado:
-                    existente = Cliente.query.filter_by(
-                        estabelecimento_id=estabelecimento_id,
-                        cpf=cpf_formatado
-                    ).first()
-                    
-                    if existente:
-                        errors.append(f"Linha {row_idx}: CPF {cpf_formatado} já cadastrado")
-                        error_count += 1
-                        continue
-
-                limite = Decimal(limite_str) if limite_str.replace('.','',1).isdigit() else Decimal('0')
-                saldo = Decimal(saldo_str) if saldo_str.replace('.','',1).isdigit() else Decimal('0')
-
-                novo_cliente = Cliente(
-                    estabelecimento_id=estabelecimento_id,
-                    nome=nome,
-                    cpf=cpf_formatado,
-                    celular=celular_formatado,
-                    email=row.get('email', '').strip().lower(),
-                    limite_credito=limite,
-                    saldo_devedor=saldo,
-                    total_compras=0,
-                    valor_total_gasto=Decimal('0'),
-                    ativo=True
-                )
-                
-                db.session.add(novo_cliente)
-                db.session.flush() # para pegar o ID
-                
-                # Se tem saldo devedor (fiado antigo), gera o Contas a Receber
-                if saldo > 0:
-                    nova_conta = ContaReceber(
-                        estabelecimento_id=estabelecimento_id,
-                        cliente_id=novo_cliente.id,
-                        descricao=f"Migração de Saldo Inicial - {nome}",
-                        valor_original=saldo,
-                        valor_atual=saldo,
-                        data_vencimento=date.today() + timedelta(days=30),
-                        data_emissao=date.today(),
-                        status='aberto'
-                    )
-                    db.session.add(nova_conta)
-                
-                success_count += 1
-                
-                if success_count % 50 == 0:
-                    db.session.commit()
-                    
-            except Exception as row_err:
-                db.session.rollback()
-                errors.append(f"Linha {row_idx}: Erro inesperado - {str(row_err)}")
-                error_count += 1
-                
-        db.session.commit()
-        
-        # Log Audit
-        from app.models import Auditoria
-        Auditoria.registrar(
-            estabelecimento_id=estabelecimento_id,
-            tipo_evento="cliente_importado",
-            descricao=f"Importação de {success_count} clientes via CSV",
-            valor=Decimal('0'),
-            detalhes={"sucesso": success_count, "erros": error_count, "metodo": "import_bulk"}
-        )
-        
-        return jsonify({
-            "success": True,
-            "message": f"Importação concluída: {success_count} importados, {error_count} erros.",
-            "total_importados": success_count,
-            "total_erros": error_count,
-            "erros": errors[:10]
-        })
-        
+        return responder_importacao("clientes", file, estabelecimento_id, request.values, get_jwt().get("sub"))
+
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Erro na importação de clientes: {str(e)}")
         return jsonify({"success": False, "message": f"Erro interno na importação: {str(e)}"}), 500
+
+
+@clientes_bp.route("/importar/<handle>", methods=["GET"])
+@funcionario_required
+def status_importacao_clientes(handle):
+    """Progresso e erros por linha de uma importação de clientes."""
+    job = ImportacaoService.localizar(handle, "clientes", get_authorized_establishment_id())
+    if not job:
+        return jsonify({"success": False, "message": "Importação não encontrada"}), 404
+    return jsonify({"success": True, "importacao": job.to_dict()})
+
+
+@clientes_bp.route("/importar/<handle>/confirmar", methods=["POST"])
+@funcionario_required
+@permission_required('clientes')
+def confirmar_importacao_clientes(handle):
+    """Executa de verdade uma simulação concluída (mesmo arquivo, sem reenvio)."""
+    job = ImportacaoService.localizar(handle, "clientes", get_authorized_establishment_id())
+    if not job:
+        return jsonify({"success": False, "message": "Importação não encontrada"}), 404
+    try:
+        return resposta_importacao(ImportacaoService.confirmar(job))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 409
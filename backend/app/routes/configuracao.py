@@ -11,6 +11,7 @@ from app import db
 from app.models import Configuracao, FuncionarioPreferencias, CondicaoPagamento
 from app.utils.query_helpers import get_configuracao_safe, get_estabelecimento_full_safe, get_authorized_establishment_id
 from app.utils.smart_cache import get_cached_config, set_cached_config, invalidate_config
+from app.services.pin_service import PinBloqueado
 import json
 import traceback
 
@@ -338,21 +339,14 @@ def update_estabelecimento():
 
 # ==================== PIN DE SEGURANÇA (autorização de operações sensíveis) ====================
 
-def autorizar_por_pin(estabelecimento_id, pin):
+def autorizar_por_pin(estabelecimento_id, pin, origem=None):
     """
     Valida um PIN contra os admins/gerentes (nível ≤ 2) do tenant.
-    Retorna o Funcionario autorizador ou None. Mesma regra usada no estorno de venda.
+    Retorna o Funcionario autorizador ou None. Mesma regra usada no estorno de venda
+    (busca indexada + um hash, ver app.services.pin_service); pode levantar PinBloqueado.
     """
-    from app.models import Funcionario
-    pin = (str(pin or "")).strip()
-    if not pin:
-        return None
-    candidatos = Funcionario.query.filter(
-        Funcionario.estabelecimento_id == estabelecimento_id,
-        Funcionario.pin_cancelamento.isnot(None),
-        Funcionario.nivel_acesso <= 2,
-    ).all()
-    return next((f for f in candidatos if f.check_pin(pin)), None)
+    from app.services.pin_service import PinService, origem_da_requisicao
+    return PinService.autorizar(estabelecimento_id, pin, origem=origem or origem_da_requisicao(estabelecimento_id))
 
 
 @configuracao_bp.route("/verificar-pin", methods=["POST"])
@@ -364,7 +358,12 @@ def verificar_pin_seguranca():
         if not estabelecimento_id:
             return jsonify({"success": False, "error": "Estabelecimento não identificado"}), 400
         pin = (request.get_json() or {}).get("pin", "")
-        autorizador = autorizar_por_pin(estabelecimento_id, pin)
+        try:
+            autorizador = autorizar_por_pin(estabelecimento_id, pin)
+        except PinBloqueado as e:
+            resp = jsonify({"success": False, "error": str(e), "retry_after": e.retry_after})
+            resp.headers["Retry-After"] = str(e.retry_after)
+            return resp, 429
         if not autorizador:
             return jsonify({"success": False, "error": "PIN inválido"}), 403
         return jsonify({"success": True, "autorizador": autorizador.nome}), 200
@@ -399,7 +398,10 @@ def pin_seguranca():
             return jsonify({"success": False, "error": "Usuário não encontrado"}), 404
 
         if request.method == "GET":
-            return jsonify({"success": True, "tem_pin": funcionario.tem_pin}), 200
+            from app.services.pin_service import PinService
+            # pins_pendentes: autorizadores da loja ainda sem chave de busca (migram no próximo uso)
+            return jsonify({"success": True, "tem_pin": funcionario.tem_pin,
+                            "pins_pendentes": PinService.pendentes_migracao(estabelecimento_id)}), 200
 
         # PUT
         pin = (str((request.get_json() or {}).get("pin", ""))).strip()
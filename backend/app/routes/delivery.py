@@ -3,7 +3,7 @@ MercadinhoSys - Rotas de Delivery Profissional
 Integração total com os modelos: Motorista, Veiculo, Entrega, TaxaEntrega
 """
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app.models import (
     db, Motorista, Veiculo, TaxaEntrega, Entrega,
@@ -12,13 +12,15 @@ from app.models import (
     ChecklistVeiculo, ITENS_CHECKLIST_PADRAO,
 )
 from app.decorators.rbac import tenant_or_super_admin_required
+from app.services.midia_service import MidiaService
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 import json
 import logging
 import os
-import uuid
 from sqlalchemy import or_, and_, func
+from app.utils.query_helpers import filtro_periodo
+from app.utils.timezone import hoje_local
 
 delivery_bp = Blueprint("delivery", __name__)
 logger = logging.getLogger(__name__)
@@ -29,12 +31,11 @@ EXTENSOES_DOCUMENTO = {"pdf", "jpg", "jpeg", "png"}
 TAMANHO_MAXIMO_DOCUMENTO = 5 * 1024 * 1024  # 5MB
 
 
-def _salvar_documento(arquivo, subpasta: str, prefixo: str):
-    """Valida e salva um documento (CNH/CRLV) com sanitização de nome,
-    whitelist de extensão e limite de tamanho. Retorna a URL pública ou
-    lança ValueError com a mensagem de validação."""
-    from werkzeug.utils import secure_filename
-
+def _salvar_documento(arquivo, subpasta: str, prefixo: str, registro, coluna: str):
+    """Valida o documento (CNH/CRLV) — whitelist de extensão e limite de
+    tamanho — e o coloca no spool do pipeline de mídia, apontando a coluna do
+    registro para a URL provisória. Retorna o MidiaUpload (despachar após o
+    commit) ou lança ValueError com a mensagem de validação."""
     nome_original = arquivo.filename or ""
     extensao = nome_original.rsplit(".", 1)[-1].lower() if "." in nome_original else ""
     if extensao not in EXTENSOES_DOCUMENTO:
@@ -46,36 +47,9 @@ def _salvar_documento(arquivo, subpasta: str, prefixo: str):
     if tamanho > TAMANHO_MAXIMO_DOCUMENTO:
         raise ValueError("Documento muito grande. Tamanho máximo: 5MB.")
 
-    nome_seguro = secure_filename(nome_original) or f"documento.{extensao}"
-    filename = f"{prefixo}_{uuid.uuid4().hex[:10]}_{nome_seguro}"
-
-    documento_url = None
-    if os.getenv("CLOUDINARY_URL"):
-        try:
-            import cloudinary.uploader
-            import base64
-            doc_bytes = arquivo.read()
-            doc_b64 = f"data:{arquivo.content_type};base64,{base64.b64encode(doc_bytes).decode('utf-8')}"
-            
-            result = cloudinary.uploader.upload(
-                doc_b64,
-                folder=f"mercadinhosys/{subpasta}",
-                public_id=filename.rsplit(".", 1)[0],
-                resource_type="auto"
-            )
-            documento_url = result.get("secure_url")
-        except Exception as e:
-            current_app.logger.error(f"Erro Cloudinary (delivery): {e}")
-            documento_url = None
-
-    if not documento_url:
-        arquivo.seek(0)
-        upload_dir = os.path.join(current_app.config.get("UPLOAD_FOLDER", "uploads"), subpasta)
-        os.makedirs(upload_dir, exist_ok=True)
-        arquivo.save(os.path.join(upload_dir, filename))
-        documento_url = f"/uploads/{subpasta}/{filename}"
-
-    return documento_url
+    midia = MidiaService.receber_arquivo(arquivo, subpasta, prefixo, request.allowed_estabelecimento_id)
+    MidiaService.vincular(midia, registro, coluna)
+    return midia
 
 # ==================== MOTORISTAS & VEÍCULOS ====================
 
@@ -176,10 +150,10 @@ def upload_documento_motorista(id):
         if not arquivo:
             return jsonify({"success": False, "error": "Nenhum arquivo enviado"}), 400
 
-        url = _salvar_documento(arquivo, "motoristas", f"cnh_{id}")
-        motorista.cnh_documento_url = url
+        midia = _salvar_documento(arquivo, "motoristas", f"cnh_{id}", motorista, "cnh_documento_url")
         db.session.commit()
-        return jsonify({"success": True, "cnh_documento_url": url})
+        MidiaService.despachar(midia)
+        return jsonify({"success": True, "cnh_documento_url": midia.url_provisoria})
     except ValueError as ve:
         return jsonify({"success": False, "error": str(ve)}), 400
     except Exception as e:
@@ -292,10 +266,10 @@ def upload_documento_veiculo(id):
         if not arquivo:
             return jsonify({"success": False, "error": "Nenhum arquivo enviado"}), 400
 
-        url = _salvar_documento(arquivo, "veiculos", f"crlv_{id}")
-        veiculo.crlv_documento_url = url
+        midia = _salvar_documento(arquivo, "veiculos", f"crlv_{id}", veiculo, "crlv_documento_url")
         db.session.commit()
-        return jsonify({"success": True, "crlv_documento_url": url})
+        MidiaService.despachar(midia)
+        return jsonify({"success": True, "crlv_documento_url": midia.url_provisoria})
     except ValueError as ve:
         return jsonify({"success": False, "error": str(ve)}), 400
     except Exception as e:
@@ -837,9 +811,10 @@ def get_stats():
     try:
         est_id = request.allowed_estabelecimento_id
         
+        hoje = hoje_local()
         total_hoje = Entrega.query.filter(
             Entrega.estabelecimento_id == est_id,
-            func.date(Entrega.created_at) == date.today()
+            filtro_periodo(Entrega.created_at, hoje, hoje)
         ).count()
         
         pendentes = Entrega.query.filter_by(estabelecimento_id=est_id, status="pendente").count()
@@ -847,7 +822,7 @@ def get_stats():
         entregues_hoje = Entrega.query.filter(
             Entrega.estabelecimento_id == est_id,
             Entrega.status == "entregue",
-            func.date(Entrega.data_entrega) == date.today()
+            filtro_periodo(Entrega.data_entrega, hoje, hoje)
         ).count()
         
         # Top Motoristas (últimos 30 dias)
@@ -984,12 +959,10 @@ def dashboard_logistica():
         motorista_id = request.args.get("motorista_id", type=int)
         veiculo_id = request.args.get("veiculo_id", type=int)
 
-        data_ref = func.coalesce(Entrega.data_entrega, Entrega.data_saida, Entrega.created_at)
+        data_ref = Entrega.data_referencia
         filtros = [Entrega.estabelecimento_id == est_id, Entrega.deleted_at.is_(None)]
-        if di:
-            filtros.append(func.date(data_ref) >= datetime.strptime(di, "%Y-%m-%d").date())
-        if df:
-            filtros.append(func.date(data_ref) <= datetime.strptime(df, "%Y-%m-%d").date())
+        if di or df:
+            filtros.append(filtro_periodo(data_ref, di or None, df or None))
         if motorista_id:
             filtros.append(Entrega.motorista_id == motorista_id)
         if veiculo_id:
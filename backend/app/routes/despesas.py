@@ -15,7 +15,14 @@ from app.services.rh_calculator_service import (
     calcular_custo_folha_detalhado,
     calcular_custo_folha_periodos,
 )
-from app.utils.financeiro_constants import sem_categorias_integradas
+from app.services.financeiro_mensal_service import (
+    FinanceiroMensalService,
+    meses_inteiros,
+    DESPESA as RUBRICA_DESPESA,
+    DESPESA_RECORRENTE as RUBRICA_DESPESA_RECORRENTE,
+    PAGAR_PAGO as RUBRICA_PAGAR_PAGO,
+)
+from app.utils.financeiro_constants import CATEGORIAS_INTEGRADAS, sem_categorias_integradas
 
 despesas_bp = Blueprint("despesas", __name__)
 
@@ -364,7 +371,6 @@ def obter_estatisticas_despesas():
         hoje = datetime.now().date()
         mes_atual_inicio = hoje.replace(day=1)
         mes_anterior_inicio = (mes_atual_inicio - timedelta(days=1)).replace(day=1)
-        mes_anterior_fim = mes_atual_inicio - timedelta(days=1)
         ontem = hoje - timedelta(days=1)
         semana_inicio = hoje - timedelta(days=6)
 
@@ -393,18 +399,27 @@ def obter_estatisticas_despesas():
                 mes_fim = mes_data.replace(month=mes_data.month + 1, day=1) - timedelta(days=1)
             meses_evolucao.append((mes_data, mes_fim))
 
-        # ── FOLHA EM LOTE: uma chamada para TODAS as janelas ──────────────────
+        # ── RAZÃO MENSAL: mês anterior, evolução e totais gerais ──────────────
+        # Uma consulta em financeiro_mensal (FinanceiroMensalService) substitui
+        # os GROUP BY por EXTRACT(ano/mês) de despesas e contas; só as janelas
+        # que cortam um mês (hoje, ontem, semana, mês até hoje e o período)
+        # ainda agregam as tabelas de origem.
+        razao = FinanceiroMensalService.ler(estabelecimento_id)
+        competencias = [m for m, _ in meses_evolucao]
+        folha_mensal = FinanceiroMensalService.folha(
+            estabelecimento_id, sorted(set(competencias) | {mes_anterior_inicio}), razao)
+
+        # ── FOLHA EM LOTE: uma chamada para as janelas que cortam um mês ──────
         # Antes: 11 chamadas de calcular_custo_folha_detalhado por request, cada
         # uma com 1 query de configuração POR funcionário — a causa nº 1 da
-        # lentidão desta página.
+        # lentidão desta página. Meses inteiros vêm do razão (folha_mensal).
         janelas = [
             (mes_atual_inicio, hoje),            # 0
-            (mes_anterior_inicio, mes_anterior_fim),  # 1
-            (hoje, hoje),                        # 2
-            (ontem, ontem),                      # 3
-            (semana_inicio, hoje),               # 4
-            (cat_inicio, cat_fim),               # 5
-        ] + meses_evolucao                       # 6..11
+            (hoje, hoje),                        # 1
+            (ontem, ontem),                      # 2
+            (semana_inicio, hoje),               # 3
+            (cat_inicio, cat_fim),               # 4
+        ]
         try:
             folhas = calcular_custo_folha_periodos(estabelecimento_id, janelas)
         except Exception as e_folha:
@@ -414,7 +429,7 @@ def obter_estatisticas_despesas():
         def _folha(idx):
             return Decimal(str(folhas[idx]["custo_folha"].get("custo_real_total", 0.0)))
 
-        folha_detalhe_periodo = folhas[5]["custo_folha"]
+        folha_detalhe_periodo = folhas[4]["custo_folha"]
 
         # ── DESPESAS: uma única query com buckets por janela ──────────────────
         # Agregados excluem as categorias integradas (ver CATEGORIAS_INTEGRADAS)
@@ -427,12 +442,9 @@ def obter_estatisticas_despesas():
             _bucket(Despesa.data_despesa == ontem).label("ontem"),
             _bucket(and_(Despesa.data_despesa >= semana_inicio, Despesa.data_despesa <= hoje)).label("semana"),
             _bucket(and_(Despesa.data_despesa >= mes_atual_inicio, Despesa.data_despesa <= hoje)).label("mes_atual"),
-            _bucket(and_(Despesa.data_despesa >= mes_anterior_inicio, Despesa.data_despesa <= mes_anterior_fim)).label("mes_anterior"),
             _bucket(and_(Despesa.data_despesa >= cat_inicio, Despesa.data_despesa <= cat_fim)).label("periodo"),
-            func.coalesce(func.sum(Despesa.valor), 0).label("total_geral"),
-            func.count(Despesa.id).label("qtd_geral"),
-            func.coalesce(func.sum(case((Despesa.recorrente == True, Despesa.valor), else_=0)), 0).label("recorrentes"),
-        )
+        ).filter(Despesa.data_despesa >= min(semana_inicio, mes_atual_inicio, cat_inicio),
+                 Despesa.data_despesa <= max(hoje, cat_fim))
         if estabelecimento_id != 'all':
             q_desp = q_desp.filter(Despesa.estabelecimento_id == estabelecimento_id)
         q_desp = _sem_categorias_integradas(q_desp)
@@ -449,13 +461,13 @@ def obter_estatisticas_despesas():
             _cp_bucket(ontem, ontem).label("ontem"),
             _cp_bucket(semana_inicio, hoje).label("semana"),
             _cp_bucket(mes_atual_inicio, hoje).label("mes_atual"),
-            _cp_bucket(mes_anterior_inicio, mes_anterior_fim).label("mes_anterior"),
             _cp_bucket(cat_inicio, cat_fim).label("periodo"),
             func.coalesce(func.sum(case(
                 (and_(ContaPagar.data_pagamento >= cat_inicio, ContaPagar.data_pagamento <= cat_fim), 1),
                 else_=0)), 0).label("periodo_qtd"),
-            func.coalesce(func.sum(ContaPagar.valor_pago), 0).label("total_geral"),
-        ).filter(ContaPagar.status.in_(['pago', 'parcial']))
+        ).filter(ContaPagar.status.in_(['pago', 'parcial']),
+                 ContaPagar.data_pagamento >= min(semana_inicio, mes_atual_inicio, cat_inicio),
+                 ContaPagar.data_pagamento <= max(hoje, cat_fim))
         if estabelecimento_id != 'all':
             q_cp = q_cp.filter(ContaPagar.estabelecimento_id == estabelecimento_id)
         cp = q_cp.first()
@@ -471,13 +483,19 @@ def obter_estatisticas_despesas():
             q_vencidas = q_vencidas.filter(ContaPagar.estabelecimento_id == estabelecimento_id)
         boletos_vencidos = _D(q_vencidas.scalar() or 0)
 
-        despesas_hoje = _D(d.hoje) + _folha(2) + _D(cp.hoje) + boletos_vencidos
-        despesas_ontem = _D(d.ontem) + _folha(3) + _D(cp.ontem) + boletos_vencidos
-        despesas_semana = _D(d.semana) + _folha(4) + _D(cp.semana) + boletos_vencidos
+        def _mes(competencia):
+            """Despesas + boletos pagos + folha de um mês inteiro, direto do razão."""
+            return (razao.valor(RUBRICA_DESPESA, [competencia], CATEGORIAS_INTEGRADAS)
+                    + razao.valor(RUBRICA_PAGAR_PAGO, [competencia])
+                    + folha_mensal.get(competencia, Decimal('0')))
+
+        despesas_hoje = _D(d.hoje) + _folha(1) + _D(cp.hoje) + boletos_vencidos
+        despesas_ontem = _D(d.ontem) + _folha(2) + _D(cp.ontem) + boletos_vencidos
+        despesas_semana = _D(d.semana) + _folha(3) + _D(cp.semana) + boletos_vencidos
         despesas_mes_atual = _D(d.mes_atual) + _folha(0) + _D(cp.mes_atual) + boletos_vencidos
-        despesas_mes_anterior = _D(d.mes_anterior) + _folha(1) + _D(cp.mes_anterior)
+        despesas_mes_anterior = _mes(mes_anterior_inicio)
 
-        folha_periodo = _folha(5)
+        folha_periodo = _folha(4)
         contas_periodo_valor = _D(cp.periodo)
         contas_periodo_qtd = int(cp.periodo_qtd or 0)
         soma_periodo = _D(d.periodo) + folha_periodo + contas_periodo_valor
@@ -486,9 +504,10 @@ def obter_estatisticas_despesas():
         if cat_inicio <= hoje <= cat_fim:
             soma_periodo += boletos_vencidos
 
-        total_despesas = int(d.qtd_geral or 0)
-        soma_total = _D(d.total_geral) + _D(cp.total_geral)
-        despesas_recorrentes = _D(d.recorrentes)
+        total_geral_despesas = razao.valor(RUBRICA_DESPESA, excluir=CATEGORIAS_INTEGRADAS)
+        total_despesas = razao.quantidade(RUBRICA_DESPESA, excluir=CATEGORIAS_INTEGRADAS)
+        soma_total = total_geral_despesas + razao.valor(RUBRICA_PAGAR_PAGO)
+        despesas_recorrentes = razao.valor(RUBRICA_DESPESA_RECORRENTE, excluir=CATEGORIAS_INTEGRADAS)
 
         # ── Variação ──────────────────────────────────────────────────────────
         if despesas_mes_anterior > 0:
@@ -498,56 +517,39 @@ def obter_estatisticas_despesas():
         else:
             variacao_percentual = Decimal('100') if despesas_mes_atual > 0 else Decimal('0')
 
-        # ── Categorias do período (já sem as integradas, via SQL) ─────────────
-        query_cats = db.session.query(
-                Despesa.categoria,
-                func.sum(Despesa.valor).label("total"),
-                func.count(Despesa.id).label("quantidade"),
-            ).filter(
-                Despesa.data_despesa >= cat_inicio,
-                Despesa.data_despesa <= cat_fim,
-            )
-        if estabelecimento_id != 'all':
-            query_cats = query_cats.filter(Despesa.estabelecimento_id == estabelecimento_id)
-        query_cats = _sem_categorias_integradas(query_cats)
-        despesas_por_categoria_raw = query_cats.group_by(Despesa.categoria).order_by(func.sum(Despesa.valor).desc()).all()
-
-        # ── Evolução mensal: 2 group-bys (despesas e contas) + folha batched ──
-        from sqlalchemy import extract
-        evo_inicio, evo_fim = meses_evolucao[0][0], meses_evolucao[-1][1]
-
-        q_evo_desp = db.session.query(
-            extract('year', Despesa.data_despesa).label('ano'),
-            extract('month', Despesa.data_despesa).label('mes'),
-            func.sum(Despesa.valor).label('total'),
-        ).filter(Despesa.data_despesa >= evo_inicio, Despesa.data_despesa <= evo_fim)
-        if estabelecimento_id != 'all':
-            q_evo_desp = q_evo_desp.filter(Despesa.estabelecimento_id == estabelecimento_id)
-        q_evo_desp = _sem_categorias_integradas(q_evo_desp)
-        evo_desp = {(int(a), int(m)): _D(t) for a, m, t in q_evo_desp.group_by('ano', 'mes').all()}
-
-        q_evo_cp = db.session.query(
-            extract('year', ContaPagar.data_pagamento).label('ano'),
-            extract('month', ContaPagar.data_pagamento).label('mes'),
-            func.sum(ContaPagar.valor_pago).label('total'),
-        ).filter(ContaPagar.status.in_(['pago', 'parcial']),
-                 ContaPagar.data_pagamento >= evo_inicio, ContaPagar.data_pagamento <= evo_fim)
-        if estabelecimento_id != 'all':
-            q_evo_cp = q_evo_cp.filter(ContaPagar.estabelecimento_id == estabelecimento_id)
-        evo_cp = {(int(a), int(m)): _D(t) for a, m, t in q_evo_cp.group_by('ano', 'mes').all()}
+        # ── Categorias do período (já sem as integradas) ──────────────────────
+        # Período de meses inteiros sai do razão; um recorte qualquer agrega.
+        meses_periodo = meses_inteiros(cat_inicio, cat_fim, hoje)
+        if meses_periodo:
+            despesas_por_categoria_raw = [
+                (cat, total, qtd) for cat, (total, qtd) in
+                razao.por_categoria(RUBRICA_DESPESA, meses_periodo, CATEGORIAS_INTEGRADAS).items()
+            ]
+        else:
+            query_cats = db.session.query(
+                    Despesa.categoria,
+                    func.sum(Despesa.valor).label("total"),
+                    func.count(Despesa.id).label("quantidade"),
+                ).filter(
+                    Despesa.data_despesa >= cat_inicio,
+                    Despesa.data_despesa <= cat_fim,
+                )
+            if estabelecimento_id != 'all':
+                query_cats = query_cats.filter(Despesa.estabelecimento_id == estabelecimento_id)
+            query_cats = _sem_categorias_integradas(query_cats)
+            despesas_por_categoria_raw = query_cats.group_by(Despesa.categoria).all()
 
+        # ── Evolução mensal: consulta de dicionário no razão ──────────────────
         evolucao_mensal = []
-        for idx, (mes_data, _mes_fim) in enumerate(meses_evolucao):
-            chave = (mes_data.year, mes_data.month)
-            total_mes = evo_desp.get(chave, Decimal('0')) + evo_cp.get(chave, Decimal('0')) + _folha(6 + idx)
+        for mes_data, _mes_fim in meses_evolucao:
             evolucao_mensal.append({
                 "mes": mes_data.strftime("%Y-%m"),
-                "total": float(total_mes),
+                "total": float(_mes(mes_data)),
                 "mes_nome": mes_data.strftime("%b/%Y"),
             })
 
         # ── Médias (sobre as despesas agregáveis, não misturando boletos) ─────
-        media_valor = (_D(d.total_geral) / Decimal(str(total_despesas))) if total_despesas > 0 else Decimal('0')
+        media_valor = (total_geral_despesas / Decimal(str(total_despesas))) if total_despesas > 0 else Decimal('0')
 
         # ── Montar lista de categorias com percentual ─────────────────────────
         despesas_por_categoria_list = []
@@ -634,7 +636,7 @@ def obter_estatisticas_despesas():
                     # Não-recorrentes sobre a MESMA base das recorrentes
                     # (lançamentos de Despesa) — antes subtraía de um total que
                     # incluía boletos pagos e o número não fechava com a soma.
-                    "despesas_nao_recorrentes": float(_D(d.total_geral) - despesas_recorrentes),
+                    "despesas_nao_recorrentes": float(total_geral_despesas - despesas_recorrentes),
                     "folha_detalhe": folha_detalhe_periodo,
                     "despesas_por_categoria": despesas_por_categoria_list,
                     "evolucao_mensal": evolucao_mensal,
@@ -662,7 +664,6 @@ def obter_estatisticas_despesas():
 def detalhamento_unificado():
     from app.utils.query_helpers import get_authorized_establishment_id
     from app.models import Despesa, ContaPagar
-    from app.services.rh_calculator_service import calcular_custo_folha_detalhado
     from datetime import datetime
 
     estabelecimento_id = get_authorized_establishment_id()
@@ -767,8 +768,7 @@ def detalhamento_unificado():
     # 3. Folha de Pagamento
     if recorrente is None:
         try:
-            folha = calcular_custo_folha_detalhado(estabelecimento_id, inicio, fim)
-            custo_folha = float(folha.get("custo_folha", {}).get("custo_real_total", 0.0))
+            custo_folha = float(FinanceiroMensalService.custo_folha(estabelecimento_id, inicio, fim))
             if custo_folha > 0:
                 resultados.append({
                     "id": f"f_{inicio.strftime('%Y%m%d')}",
@@ -1085,8 +1085,15 @@ def resumo_financeiro():
             dt_inicio = hoje.replace(day=1)
             dt_fim = hoje
 
-        # 🚀 CONSOLIDAÇÃO PROFISSIONAL: Reduz de 12 para 3 queries principais
-        financial_data = DataLayer.get_consolidated_financial_summary(estabelecimento_id, dt_inicio, dt_fim)
+        # 🚀 CONSOLIDAÇÃO PROFISSIONAL: Reduz de 12 para 3 queries principais.
+        # Período de meses inteiros: vendas, despesas e boletos pagos saem do
+        # razão mensal (uma consulta) em vez de agregar as tabelas de origem.
+        razao = None
+        meses_periodo = meses_inteiros(dt_inicio, dt_fim)
+        if meses_periodo and estabelecimento_id != 'all':
+            razao = FinanceiroMensalService.ler(estabelecimento_id, meses_periodo[0], meses_periodo[-1])
+        financial_data = DataLayer.get_consolidated_financial_summary(estabelecimento_id, dt_inicio, dt_fim,
+                                                                      razao=razao)
         
         if not financial_data:
              return jsonify({"error": "Falha ao consolidar dados financeiros"}), 500
@@ -1111,9 +1118,8 @@ def resumo_financeiro():
 
         # 1. Índice de Comprometimento: dívida em aberto + obrigações a vencer (30d) vs faturamento do período.
         # Adiciona também a provisão da folha de pagamento do período como uma obrigação real.
-        folha_detalhada = calcular_custo_folha_detalhado(estabelecimento_id, dt_inicio, dt_fim)
-        custo_folha_total = folha_detalhada.get("custo_folha", {}).get("custo_real_total", 0.0)
-        
+        custo_folha_total = desp.get("despesas_pessoal", 0.0)
+
         total_obrigacoes = total_pagar_aberto + dav['vence_30d'] + dav['vencidas'] + custo_folha_total
         if receita_bruta > 0:
             indice_comprometimento = total_obrigacoes / receita_bruta * 100
@@ -1239,7 +1245,6 @@ def historico_comparativo():
     identificação de categorias com maior crescimento e insights inteligentes.
     """
     try:
-        from sqlalchemy import func, extract
         from datetime import date, timedelta
         from collections import defaultdict
 
@@ -1268,33 +1273,20 @@ def historico_comparativo():
                 fim_m = hoje
             meses.append((m, fim_m))
 
-        # Query: soma por mês e categoria
-        inicio_periodo = meses[0][0]
-
-        query = db.session.query(
-            Despesa.categoria,
-            extract('year', Despesa.data_despesa).label('ano'),
-            extract('month', Despesa.data_despesa).label('mes_num'),
-            func.sum(Despesa.valor).label('total'),
-            func.count(Despesa.id).label('qtd'),
-        ).filter(
-            Despesa.data_despesa >= inicio_periodo,
-            Despesa.data_despesa <= hoje,
-        )
-        if estabelecimento_id != 'all':
-            query = query.filter(Despesa.estabelecimento_id == estabelecimento_id)
-
-        rows = query.group_by(Despesa.categoria, extract('year', Despesa.data_despesa), extract('month', Despesa.data_despesa)).all()
+        # Soma por mês e categoria: uma consulta no razão mensal
+        # (financeiro_mensal) em vez do GROUP BY por EXTRACT(ano/mês) em despesas
+        razao = FinanceiroMensalService.ler(estabelecimento_id, meses[0][0], hoje)
 
         # Indexa os dados: {mes: {categoria: {total, qtd}}}
         dados_mes_cat = defaultdict(lambda: defaultdict(lambda: {"total": 0.0, "qtd": 0}))
         todas_categorias = set()
-        for cat, ano, mes_num, total, qtd in rows:
-            categoria = cat or "outros"
-            mes_str = f"{int(ano):04d}-{int(mes_num):02d}"
-            dados_mes_cat[mes_str][categoria]["total"] += float(total or 0)
-            dados_mes_cat[mes_str][categoria]["qtd"] += int(qtd or 0)
-            todas_categorias.add(categoria)
+        for m_inicio, _ in meses:
+            mes_str = m_inicio.strftime('%Y-%m')
+            for cat, (total, qtd) in razao.por_categoria(RUBRICA_DESPESA, [m_inicio]).items():
+                categoria = cat or "outros"
+                dados_mes_cat[mes_str][categoria]["total"] += float(total or 0)
+                dados_mes_cat[mes_str][categoria]["qtd"] += int(qtd or 0)
+                todas_categorias.add(categoria)
 
         # Totais por mês
         totais_mes = {}
@@ -1565,4 +1557,25 @@ def boletos_por_status():
         current_app.logger.error(f"Erro ao buscar boletos por status: {str(e)}")
         import traceback
         current_app.logger.error(traceback.format_exc())
-        return jsonify({"error": "Erro interno do servidor", "message": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": "Erro interno do servidor", "message": str(e)}), 500
+
+@despesas_bp.route("/financeiro-mensal", methods=["GET"], strict_slashes=False)
+@despesas_bp.route("/financeiro-mensal/", methods=["GET"], strict_slashes=False)
+@funcionario_required
+@plan_required('Pro')
+def financeiro_mensal():
+    """
+    Série mensal do razão financeiro (receita, CMV, despesas, folha, contas a
+    pagar/receber) dos últimos `meses` com a variação sobre o mês anterior.
+    """
+    from app.utils.query_helpers import get_authorized_establishment_id
+    estabelecimento_id = get_authorized_establishment_id()
+    if not estabelecimento_id:
+        return jsonify({"success": False, "error": "Estabelecimento não identificado"}), 400
+
+    meses = min(max(request.args.get("meses", 12, type=int), 1), 36)
+    try:
+        return jsonify({"success": True, "meses": FinanceiroMensalService.comparativo(estabelecimento_id, meses)})
+    except Exception as e:
+        current_app.logger.error(f"Erro ao ler razão financeiro mensal: {str(e)}")
+        return jsonify({"success": False, "error": "Erro interno do servidor"}), 500
@@ -4,17 +4,27 @@ Rotas fiscais — MercadinhoSys.
 Entrada (compra):
 - POST /api/fiscal/entrada/preview     → lê o XML e mostra o que será importado (não grava)
 - POST /api/fiscal/entrada/importar    → efetiva a importação (estoque, custo, contas a pagar)
+- POST /api/fiscal/entrada/importar-lote → importa um ZIP com várias NF-e (pula as já importadas)
 - GET  /api/fiscal/entrada             → lista as notas de entrada já importadas
 - GET  /api/fiscal/entrada/<id>/xml    → baixa o XML guardado
+
+Saída (NFC-e):
+- POST /api/fiscal/vendas/<id>/nfce            → emissão/reemissão síncrona
+- GET  /api/fiscal/documentos/<id>/status      → status do documento (long-poll com ?aguardar=N)
+- GET  /api/fiscal/fila                        → situação da fila de emissão, contingência e lacunas
+- POST /api/fiscal/contingencia/transmitir     → transmite agora os documentos em contingência
+- POST /api/fiscal/lacunas/<id>/inutilizada    → marca lacuna como inutilizada na SEFAZ
 """
 from flask import Blueprint, request, jsonify, current_app, Response
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from app.models import db, NotaFiscalEntrada, DocumentoFiscal, Venda, Estabelecimento
+from app.models import db, NotaFiscalEntrada, DocumentoFiscal, NumeracaoFiscalLacuna, Venda, Estabelecimento, utcnow
 from app.utils.query_helpers import get_authorized_establishment_id
 from app.services.fiscal.xml_parser import parse_nfe_xml, XMLNotaError
 from app.services.fiscal import entrada_service
 from app.services.fiscal import emissao_service
+from app.services.fiscal.fila_emissao import FilaEmissaoNFCe
+from app.services.fiscal.contingencia import ContingenciaService
 
 fiscal_bp = Blueprint("fiscal", __name__)
 
@@ -72,6 +82,36 @@ def entrada_importar():
         return jsonify({"success": False, "error": "Falha ao importar a nota"}), 500
 
 
+@fiscal_bp.route("/entrada/importar-lote", methods=["POST"])
+@jwt_required()
+def entrada_importar_lote():
+    try:
+        estab_id = get_authorized_establishment_id()
+        if not estab_id:
+            return jsonify({"success": False, "error": "Estabelecimento não identificado"}), 400
+        funcionario_id = int(get_jwt_identity())
+        if request.files:
+            f = request.files.get("zip") or request.files.get("file") or next(iter(request.files.values()))
+            zip_bytes = f.read()
+        else:
+            zip_bytes = request.get_data() or b""
+        if not zip_bytes:
+            return jsonify({"success": False, "error": "Nenhum ZIP enviado (use multipart 'zip' ou o corpo da requisição)."}), 400
+        resultado = entrada_service.importar_lote(zip_bytes, estab_id, funcionario_id)
+        return jsonify({
+            "success": True,
+            "message": f"{resultado['importadas']} nota(s) importada(s)",
+            "resultado": resultado,
+        }), 200
+    except entrada_service.ImportacaoError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erro em entrada_importar_lote: {e}")
+        return jsonify({"success": False, "error": "Falha ao importar o lote"}), 500
+
+
 @fiscal_bp.route("/entrada", methods=["GET"])
 @jwt_required()
 def entrada_listar():
@@ -123,12 +163,18 @@ def emitir_nfce(venda_id):
         if not estab or not venda:
             return jsonify({"success": False, "error": "Venda ou estabelecimento não encontrado"}), 404
         doc = emissao_service.emitir_nfce(venda, estab, funcionario_id)
-        http = 201 if doc.status in ("autorizado", "processando") else 422
+        aceito = doc.status in ("autorizado", "processando", "fila", "contingencia")
+        if doc.status == "autorizado":
+            mensagem = "NFC-e autorizada"
+        elif doc.status == "contingencia":
+            mensagem = "NFC-e emitida em contingência; será transmitida quando o gateway voltar"
+        else:
+            mensagem = doc.motivo_rejeicao or "Em processamento"
         return jsonify({
-            "success": doc.status in ("autorizado", "processando"),
+            "success": aceito,
             "documento": doc.to_dict(),
-            "message": "NFC-e autorizada" if doc.status == "autorizado" else (doc.motivo_rejeicao or "Em processamento"),
-        }), http
+            "message": mensagem,
+        }), (201 if aceito else 422)
     except emissao_service.EmissaoError as e:
         db.session.rollback()
         return jsonify({"success": False, "error": str(e)}), 400
@@ -139,6 +185,78 @@ def emitir_nfce(venda_id):
         return jsonify({"success": False, "error": "Falha ao emitir NFC-e"}), 500
 
 
+@fiscal_bp.route("/documentos/<int:doc_id>/status", methods=["GET"])
+@jwt_required()
+def status_documento(doc_id):
+    """Status da NFC-e para o caixa. Com ?aguardar=N (até NFCE_AGUARDAR_MAX_SEC, 5 s
+    por padrão) segura a resposta até o documento sair da fila — o PDV não precisa
+    martelar o endpoint e repete a chamada se o documento ainda estiver na fila."""
+    try:
+        estab_id = get_authorized_establishment_id()
+        aguardar = request.args.get("aguardar", 0, type=float)
+        doc = FilaEmissaoNFCe.aguardar_status(doc_id, estab_id, timeout=aguardar)
+        if not doc:
+            return jsonify({"success": False, "error": "Documento não encontrado"}), 404
+        return jsonify({
+            "success": True,
+            "status": doc.status,
+            "numero": doc.numero,
+            "serie": doc.serie,
+            "chave_acesso": doc.chave_acesso,
+            "motivo_rejeicao": doc.motivo_rejeicao,
+            "tentativas": doc.tentativas or 0,
+            "proxima_tentativa_em": doc.proxima_tentativa_em.isoformat() if doc.proxima_tentativa_em else None,
+        }), 200
+    except Exception as e:
+        current_app.logger.error(f"Erro em status_documento: {e}")
+        return jsonify({"success": False, "error": "Falha ao consultar documento"}), 500
+
+
+@fiscal_bp.route("/fila", methods=["GET"])
+@jwt_required()
+def fila_emissao():
+    try:
+        estab_id = get_authorized_establishment_id()
+        return jsonify({"success": True, "fila": FilaEmissaoNFCe.resumo(estab_id)}), 200
+    except Exception as e:
+        current_app.logger.error(f"Erro em fila_emissao: {e}")
+        return jsonify({"success": False, "error": "Falha ao consultar fila"}), 500
+
+
+@fiscal_bp.route("/contingencia/transmitir", methods=["POST"])
+@jwt_required()
+def transmitir_contingencia():
+    """Dispara a transmissão dos documentos em contingência do estabelecimento
+    (os workers da fila já fazem isso sozinhos quando o gateway volta)."""
+    try:
+        estab_id = get_authorized_establishment_id()
+        consultas = ContingenciaService.consultar_pendentes()
+        resultado = ContingenciaService.transmitir(estab_id=estab_id)
+        resultado["consultados"] = len(consultas)
+        return jsonify({"success": True, "resultado": resultado, "fila": FilaEmissaoNFCe.resumo(estab_id)}), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erro em transmitir_contingencia: {e}")
+        return jsonify({"success": False, "error": "Falha ao transmitir contingência"}), 500
+
+
+@fiscal_bp.route("/lacunas/<int:lacuna_id>/inutilizada", methods=["POST"])
+@jwt_required()
+def marcar_lacuna_inutilizada(lacuna_id):
+    try:
+        estab_id = get_authorized_establishment_id()
+        lacuna = NumeracaoFiscalLacuna.query.filter_by(id=lacuna_id, estabelecimento_id=estab_id).first()
+        if not lacuna:
+            return jsonify({"success": False, "error": "Lacuna não encontrada"}), 404
+        lacuna.inutilizada_em = utcnow()
+        db.session.commit()
+        return jsonify({"success": True, "lacuna": lacuna.to_dict()}), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erro em marcar_lacuna_inutilizada: {e}")
+        return jsonify({"success": False, "error": "Falha ao atualizar lacuna"}), 500
+
+
 @fiscal_bp.route("/documentos", methods=["GET"])
 @jwt_required()
 def listar_documentos():
@@ -17,7 +17,10 @@ from app.models import (
     PedidoCompra,
     Produto,
     ContaPagar,
+    FornecedorMetrica,
 )
+from app.services.fornecedor_metricas_service import FornecedorMetricasService
+from app.services.exportacao_service import Coluna, Exportacao, registrar_exportacao, responder
 from app.utils import validar_cnpj, validar_email, formatar_telefone
 
 fornecedores_bp = Blueprint("fornecedores", __name__)
@@ -142,6 +145,27 @@ def calcular_classificacao_fornecedor(fornecedor):
         return "C"
 
 
+def aplicar_filtros_fornecedores(query, args):
+    """Filtros da listagem de fornecedores (ativo, classificação, busca).
+
+    `query` já deve ter o snapshot fornecedores_metricas em outer join —
+    classificação e busca são lidas dele."""
+    ativo = args.get("ativo", None, type=str)
+    classificacao = args.get("classificacao", None, type=str)
+    busca = args.get("busca", "", type=str).strip()
+
+    if ativo is not None:
+        query = query.filter(Fornecedor.ativo == (ativo.lower() == "true"))
+
+    if classificacao:
+        query = query.filter(FornecedorMetrica.classificacao == classificacao.upper())
+
+    if busca:
+        # Nome/razão/contato/e-mail já normalizados no snapshot (índice por estabelecimento)
+        query = query.filter(FornecedorMetricasService.filtro_busca(busca))
+    return query
+
+
 # ============================================
 # ROTAS DE FORNECEDORES
 # ============================================
@@ -153,41 +177,25 @@ def calcular_classificacao_fornecedor(fornecedor):
 def listar_fornecedores():
     """Lista todos os fornecedores com filtros e paginação"""
     try:
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         if not estabelecimento_id:
             return jsonify({"success": False, "error": "Estabelecimento não identificado"}), 400
         
         pagina = request.args.get("pagina", 1, type=int)
         por_pagina = request.args.get("por_pagina", 50, type=int)
-        ativo = request.args.get("ativo", None, type=str)
-        classificacao = request.args.get("classificacao", None, type=str)
-        busca = request.args.get("busca", "", type=str).strip()
 
-        # Query base
+        # Query base: fornecedor + snapshot analítico (fornecedores_metricas)
         if str(estabelecimento_id).lower() == 'all':
              query = Fornecedor.query
         else:
+             FornecedorMetricasService.garantir_snapshot(estabelecimento_id)
              query = Fornecedor.query.filter_by(estabelecimento_id=estabelecimento_id)
+        query = query.outerjoin(
+            FornecedorMetrica, FornecedorMetrica.fornecedor_id == Fornecedor.id
+        ).add_entity(FornecedorMetrica)
 
-        # Filtros
-        if ativo is not None:
-            query = query.filter_by(ativo=ativo.lower() == "true")
-
-        if classificacao:
-            query = query.filter_by(classificacao=classificacao.upper())
-
-        if busca:
-            busca_termo = f"%{busca}%"
-            query = query.filter(
-                db.or_(
-                    ilike_unaccent(Fornecedor.nome_fantasia, busca_termo),
-                    ilike_unaccent(Fornecedor.razao_social, busca_termo),
-                    ilike_unaccent(Fornecedor.cnpj, busca_termo),
-                    ilike_unaccent(Fornecedor.email, busca_termo),
-                    ilike_unaccent(Fornecedor.contato_nome, busca_termo),
-                )
-            )
+        query = aplicar_filtros_fornecedores(query, request.args)
 
         # Ordenação
         query = query.order_by(
@@ -197,27 +205,22 @@ def listar_fornecedores():
         # Paginação
         paginacao = query.paginate(page=pagina, per_page=por_pagina, error_out=False)
 
-        fornecedores = []
-        for fornecedor in paginacao.items:
-            fornecedor_dict = fornecedor.to_dict()
-            fornecedor_dict["classificacao"] = calcular_classificacao_fornecedor(
-                fornecedor
+        # Produtos ativos da página inteira em UMA consulta agrupada
+        ids_pagina = [fornecedor.id for fornecedor, _ in paginacao.items]
+        produtos_ativos = {}
+        if ids_pagina:
+            produtos_ativos = dict(
+                db.session.query(Produto.fornecedor_id, db.func.count(Produto.id))
+                .filter(Produto.fornecedor_id.in_(ids_pagina), Produto.ativo.is_(True))
+                .group_by(Produto.fornecedor_id)
+                .all()
             )
-            # Adicionar última compra de forma segura
-            try:
-                last_order = fornecedor.pedidos_compra.order_by(PedidoCompra.data_pedido.desc()).first()
-                fornecedor_dict["ultima_compra"] = last_order.data_pedido.isoformat() if last_order and last_order.data_pedido else None
-            except Exception:
-                fornecedor_dict["ultima_compra"] = None
-
-            # Contar produtos ativos
-            produtos_ativos = Produto.query.filter_by(
-                fornecedor_id=fornecedor.id,
-                ativo=True,
-                estabelecimento_id=estabelecimento_id,
-            ).count()
-            fornecedor_dict["produtos_ativos"] = produtos_ativos
 
+        fornecedores = []
+        for fornecedor, metrica in paginacao.items:
+            fornecedor_dict = fornecedor.to_dict()
+            fornecedor_dict.update(FornecedorMetricasService.serializar(metrica))
+            fornecedor_dict["produtos_ativos"] = produtos_ativos.get(fornecedor.id, 0)
             fornecedores.append(fornecedor_dict)
 
         return jsonify(
@@ -234,7 +237,7 @@ def listar_fornecedores():
     except Exception as e:
         current_app.logger.error(f"Erro ao listar fornecedores: {str(e)}")
         try:
-            from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+            from app.utils.query_helpers import get_authorized_establishment_id
             estabelecimento_id = get_authorized_establishment_id()
             pagina = request.args.get("pagina", 1, type=int)
             por_pagina = request.args.get("por_pagina", 50, type=int)
@@ -314,7 +317,7 @@ def listar_fornecedores():
 def obter_fornecedor(id):
     """Obtém detalhes completos de um fornecedor específico"""
     try:
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         if not estabelecimento_id:
             return jsonify({"success": False, "error": "Estabelecimento não identificado"}), 400
@@ -415,7 +418,7 @@ def criar_fornecedor():
     """Cria um novo fornecedor"""
     try:
         # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         username = jwt_data.get("sub")
         
@@ -497,7 +500,7 @@ def atualizar_fornecedor(id):
     """Atualiza um fornecedor existente"""
     try:
         # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         username = jwt_data.get("sub")
         
@@ -594,7 +597,7 @@ def atualizar_status_fornecedor(id):
     """Ativa/desativa um fornecedor"""
     try:
         # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         username = jwt_data.get("sub")
         
@@ -670,7 +673,7 @@ def excluir_fornecedor(id):
     """Exclui um fornecedor (apenas se não houver vínculos)"""
     try:
         # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         username = jwt_data.get("sub")
         
@@ -737,7 +740,7 @@ def buscar_fornecedores():
     """Busca rápida de fornecedores para autocomplete"""
     try:
         # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         
         termo = request.args.get("q", "", type=str).strip()
@@ -747,29 +750,25 @@ def buscar_fornecedores():
         if not termo or len(termo) < 2:
             return jsonify({"success": True, "fornecedores": []})
 
-        query = Fornecedor.query.filter_by(
-            estabelecimento_id=estabelecimento_id
+        FornecedorMetricasService.garantir_snapshot(estabelecimento_id)
+        query = (
+            db.session.query(Fornecedor, FornecedorMetrica)
+            .join(FornecedorMetrica, FornecedorMetrica.fornecedor_id == Fornecedor.id)
+            .filter(FornecedorMetrica.estabelecimento_id == estabelecimento_id)
         )
 
         if apenas_ativos:
-            query = query.filter_by(ativo=True)
-
-        busca_termo = f"%{termo}%"
-        fornecedores = (
-            query.filter(
-                db.or_(
-                    ilike_unaccent(Fornecedor.nome_fantasia, busca_termo),
-                    ilike_unaccent(Fornecedor.razao_social, busca_termo),
-                    ilike_unaccent(Fornecedor.cnpj, busca_termo),
-                    ilike_unaccent(Fornecedor.contato_nome, busca_termo),
-                )
-            )
+            query = query.filter(FornecedorMetrica.ativo.is_(True))
+
+        linhas = (
+            query.filter(FornecedorMetricasService.filtro_busca(termo))
+            .order_by(FornecedorMetrica.nome_fantasia.asc())
             .limit(limite)
             .all()
         )
 
         resultados = []
-        for fornecedor in fornecedores:
+        for fornecedor, metrica in linhas:
             resultados.append(
                 {
                     "id": fornecedor.id,
@@ -779,7 +778,7 @@ def buscar_fornecedores():
                     "telefone": fornecedor.telefone,
                     "email": fornecedor.email,
                     "ativo": fornecedor.ativo,
-                    "classificacao": calcular_classificacao_fornecedor(fornecedor),
+                    "classificacao": metrica.classificacao,
                 }
             )
 
@@ -803,101 +802,13 @@ def estatisticas_fornecedores():
     """Retorna estatísticas gerais sobre fornecedores"""
     try:
         # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
 
-        # Total de fornecedores
-        total_fornecedores = Fornecedor.query.filter_by(
-            estabelecimento_id=estabelecimento_id
-        ).count()
-
-        # Fornecedores ativos
-        fornecedores_ativos = Fornecedor.query.filter_by(
-            estabelecimento_id=estabelecimento_id, ativo=True
-        ).count()
-
-        # Fornecedores inativos
-        fornecedores_inativos = total_fornecedores - fornecedores_ativos
-
-        # Classificação por tipo
-        classificacoes = (
-            db.session.query(
-                Fornecedor.classificacao, db.func.count(Fornecedor.id).label("total")
-            )
-            .filter_by(estabelecimento_id=estabelecimento_id)
-            .group_by(Fornecedor.classificacao)
-            .all()
-        )
-
-        # Fornecedores por estado
-        fornecedores_por_estado = (
-            db.session.query(
-                Fornecedor.estado, db.func.count(Fornecedor.id).label("total")
-            )
-            .filter_by(estabelecimento_id=estabelecimento_id)
-            .group_by(Fornecedor.estado)
-            .all()
-        )
-
-        # Top 5 fornecedores por volume de compras
-        top_fornecedores = (
-            Fornecedor.query.filter_by(estabelecimento_id=estabelecimento_id)
-            .order_by(Fornecedor.valor_total_comprado.desc())
-            .limit(5)
-            .all()
-        )
-
-        top_fornecedores_list = []
-        for f in top_fornecedores:
-            top_fornecedores_list.append(
-                {
-                    "id": f.id,
-                    "nome": f.nome_fantasia,
-                    "valor_total": float(f.valor_total_comprado or 0),
-                    "total_compras": f.total_compras or 0,
-                }
-            )
-
-        # Últimos fornecedores cadastrados
-        ultimos_cadastrados = (
-            Fornecedor.query.filter_by(estabelecimento_id=estabelecimento_id)
-            .order_by(Fornecedor.data_cadastro.desc())
-            .limit(5)
-            .all()
-        )
-
-        ultimos_cadastrados_list = []
-        for f in ultimos_cadastrados:
-            ultimos_cadastrados_list.append(
-                {
-                    "id": f.id,
-                    "nome": f.nome_fantasia,
-                    "data_cadastro": (
-                        f.data_cadastro.isoformat() if f.data_cadastro else None
-                    ),
-                    "classificacao": calcular_classificacao_fornecedor(f),
-                }
-            )
+        if str(estabelecimento_id).lower() != "all":
+            FornecedorMetricasService.garantir_snapshot(estabelecimento_id)
 
-        return jsonify(
-            {
-                "success": True,
-                "estatisticas": {
-                    "total": total_fornecedores,
-                    "ativos": fornecedores_ativos,
-                    "inativos": fornecedores_inativos,
-                    "percentual_ativos": (
-                        (fornecedores_ativos / total_fornecedores * 100)
-                        if total_fornecedores > 0
-                        else 0
-                    ),
-                    "classificacoes": {c[0]: c[1] for c in classificacoes},
-                    "por_estado": {e[0]: e[1] for e in fornecedores_por_estado},
-                },
-                "top_fornecedores": top_fornecedores_list,
-                "ultimos_cadastrados": ultimos_cadastrados_list,
-            }
-        )
+        return jsonify({"success": True, **FornecedorMetricasService.estatisticas(estabelecimento_id)})
 
     except Exception as e:
         current_app.logger.error(
@@ -917,7 +828,7 @@ def listar_pedidos_fornecedor(id):
     """Lista todos os pedidos de um fornecedor"""
     try:
         # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         
         pagina = request.args.get("pagina", 1, type=int)
@@ -984,180 +895,86 @@ def listar_pedidos_fornecedor(id):
         )
 
 
+@registrar_exportacao("fornecedores")
+def exportacao_fornecedores(estabelecimento_id, args):
+    """Layout de GET /api/fornecedores/exportar sobre um select só de colunas,
+    com o snapshot de métricas em outer join para os filtros da listagem."""
+    consulta = (
+        db.select(
+            Fornecedor.id, Fornecedor.nome_fantasia, Fornecedor.razao_social, Fornecedor.cnpj,
+            Fornecedor.inscricao_estadual, Fornecedor.telefone, Fornecedor.email, Fornecedor.contato_nome,
+            Fornecedor.contato_telefone, Fornecedor.prazo_entrega, Fornecedor.forma_pagamento,
+            Fornecedor.classificacao, Fornecedor.cep, Fornecedor.logradouro, Fornecedor.numero,
+            Fornecedor.complemento, Fornecedor.bairro, Fornecedor.cidade, Fornecedor.estado, Fornecedor.pais,
+            Fornecedor.ativo, Fornecedor.total_compras, Fornecedor.valor_total_comprado, Fornecedor.data_cadastro,
+        )
+        .select_from(Fornecedor)
+        .outerjoin(FornecedorMetrica, FornecedorMetrica.fornecedor_id == Fornecedor.id)
+        .where(Fornecedor.deleted_at.is_(None))
+    )
+    if str(estabelecimento_id).lower() != "all":
+        FornecedorMetricasService.garantir_snapshot(estabelecimento_id)
+        consulta = consulta.where(Fornecedor.estabelecimento_id == estabelecimento_id)
+    consulta = aplicar_filtros_fornecedores(consulta, args)
+    consulta = consulta.order_by(Fornecedor.nome_fantasia.asc(), Fornecedor.id.asc())
+    return Exportacao("fornecedores", consulta, [
+        Coluna("ID", "id"),
+        Coluna("Nome Fantasia", "nome_fantasia"),
+        Coluna("Razão Social", "razao_social"),
+        Coluna("CNPJ", "cnpj"),
+        Coluna("Inscrição Estadual", "inscricao_estadual"),
+        Coluna("Telefone", "telefone"),
+        Coluna("Email", "email"),
+        Coluna("Contato", "contato_nome"),
+        Coluna("Telefone Contato", "contato_telefone"),
+        Coluna("Prazo Entrega", "prazo_entrega"),
+        Coluna("Forma Pagamento", "forma_pagamento"),
+        Coluna("Classificação", "classificacao"),
+        Coluna("CEP", "cep"),
+        Coluna("Logradouro", "logradouro"),
+        Coluna("Número", "numero"),
+        Coluna("Complemento", "complemento"),
+        Coluna("Bairro", "bairro"),
+        Coluna("Cidade", "cidade"),
+        Coluna("Estado", "estado"),
+        Coluna("País", "pais"),
+        Coluna("Ativo", lambda f: "SIM" if f.ativo else "NÃO"),
+        Coluna("Total Compras", lambda f: f.total_compras or 0),
+        Coluna("Valor Total Comprado", lambda f: float(f.valor_total_comprado or 0)),
+        Coluna("Data Cadastro", lambda f: f.data_cadastro.strftime("%d/%m/%Y %H:%M:%S") if f.data_cadastro else ""),
+    ])
+
+
 @fornecedores_bp.route("/exportar", methods=["GET"])
 @funcionario_required
 def exportar_fornecedores():
-    """Exporta fornecedores em formato CSV ou Excel"""
+    """Exporta fornecedores em CSV (stream) ou Excel, com os filtros da listagem.
+
+    ?assincrono=true gera o arquivo em background. Sem ?ativo exporta só os
+    ativos, como sempre fez."""
     try:
-        # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
-        
-        formato = request.args.get("formato", "csv", type=str).lower()
-        apenas_ativos = request.args.get("ativo", "true", type=str).lower() == "true"
-
-        # Buscar fornecedores
-        query = Fornecedor.query.filter_by(
-            estabelecimento_id=estabelecimento_id
-        )
-
-        if apenas_ativos:
-            query = query.filter_by(ativo=True)
-
-        fornecedores = query.order_by(Fornecedor.nome_fantasia.asc()).all()
-
-        if formato == "csv":
-            # Gerar CSV
-            import csv
-            import io
-
-            output = io.StringIO()
-            writer = csv.writer(output, delimiter=";")
-
-            # Cabeçalho
-            writer.writerow(
-                [
-                    "ID",
-                    "Nome Fantasia",
-                    "Razão Social",
-                    "CNPJ",
-                    "Inscrição Estadual",
-                    "Telefone",
-                    "Email",
-                    "Contato",
-                    "Telefone Contato",
-                    "Prazo Entrega",
-                    "Forma Pagamento",
-                    "Classificação",
-                    "CEP",
-                    "Logradouro",
-                    "Número",
-                    "Complemento",
-                    "Bairro",
-                    "Cidade",
-                    "Estado",
-                    "País",
-                    "Ativo",
-                    "Total Compras",
-                    "Valor Total Comprado",
-                    "Data Cadastro",
-                ]
-            )
-
-            # Dados
-            for f in fornecedores:
-                writer.writerow(
-                    [
-                        f.id,
-                        f.nome_fantasia or "",
-                        f.razao_social or "",
-                        f.cnpj or "",
-                        f.inscricao_estadual or "",
-                        f.telefone or "",
-                        f.email or "",
-                        f.contato_nome or "",
-                        f.contato_telefone or "",
-                        f.prazo_entrega or "",
-                        f.forma_pagamento or "",
-                        f.classificacao or "",
-                        f.cep or "",
-                        f.logradouro or "",
-                        f.numero or "",
-                        f.complemento or "",
-                        f.bairro or "",
-                        f.cidade or "",
-                        f.estado or "",
-                        f.pais or "",
-                        "SIM" if f.ativo else "NÃO",
-                        f.total_compras or 0,
-                        float(f.valor_total_comprado or 0),
-                        (
-                            f.data_cadastro.strftime("%d/%m/%Y %H:%M:%S")
-                            if f.data_cadastro
-                            else ""
-                        ),
-                    ]
-                )
-
-            output.seek(0)
-            return (
-                output.getvalue(),
-                200,
-                {
-                    "Content-Type": "text/csv; charset=utf-8",
-                    "Content-Disposition": "attachment; filename=fornecedores.csv",
-                },
-            )
-
-        elif formato == "excel":
-            # Gerar Excel
-            import pandas as pd
-
-            dados = []
-            for f in fornecedores:
-                dados.append(
-                    {
-                        "ID": f.id,
-                        "Nome Fantasia": f.nome_fantasia or "",
-                        "Razão Social": f.razao_social or "",
-                        "CNPJ": f.cnpj or "",
-                        "Inscrição Estadual": f.inscricao_estadual or "",
-                        "Telefone": f.telefone or "",
-                        "Email": f.email or "",
-                        "Contato": f.contato_nome or "",
-                        "Telefone Contato": f.contato_telefone or "",
-                        "Prazo Entrega": f.prazo_entrega or "",
-                        "Forma Pagamento": f.forma_pagamento or "",
-                        "Classificação": f.classificacao or "",
-                        "CEP": f.cep or "",
-                        "Logradouro": f.logradouro or "",
-                        "Número": f.numero or "",
-                        "Complemento": f.complemento or "",
-                        "Bairro": f.bairro or "",
-                        "Cidade": f.cidade or "",
-                        "Estado": f.estado or "",
-                        "País": f.pais or "",
-                        "Ativo": "SIM" if f.ativo else "NÃO",
-                        "Total Compras": f.total_compras or 0,
-                        "Valor Total Comprado": float(f.valor_total_comprado or 0),
-                        "Data Cadastro": (
-                            f.data_cadastro.strftime("%d/%m/%Y %H:%M:%S")
-                            if f.data_cadastro
-                            else ""
-                        ),
-                    }
-                )
-
-            df = pd.DataFrame(dados)
-
-            # Salvar em buffer
-            from io import BytesIO
+        if not estabelecimento_id:
+            return jsonify({"success": False, "error": "Estabelecimento não identificado"}), 400
 
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                df.to_excel(writer, sheet_name="Fornecedores", index=False)
+        args = request.args.copy()
+        args.setdefault("ativo", "true")
+        formato = args.get("formato", "csv", type=str).lower()
+        formato = "xlsx" if formato == "excel" else formato
+        return responder("fornecedores", estabelecimento_id, args, formato, f"fornecedores.{formato}",
+                         funcionario_id=get_jwt().get("sub"))
 
-            output.seek(0)
-            return (
-                output.getvalue(),
-                200,
+    except ValueError:
+        return (
+            jsonify(
                 {
-                    "Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    "Content-Disposition": "attachment; filename=fornecedores.xlsx",
-                },
-            )
-
-        else:
-            return (
-                jsonify(
-                    {
-                        "success": False,
-                        "message": 'Formato não suportado. Use "csv" ou "excel"',
-                    }
-                ),
-                400,
-            )
-
+                    "success": False,
+                    "message": 'Formato não suportado. Use "csv" ou "excel"',
+                }
+            ),
+            400,
+        )
     except Exception as e:
         current_app.logger.error(f"Erro ao exportar fornecedores: {str(e)}")
         return (
@@ -1174,7 +991,7 @@ def importar_fornecedores():
     """Importa fornecedores a partir de arquivo CSV"""
     try:
         # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         
         if "file" not in request.files:
@@ -1317,7 +1134,7 @@ def relatorio_analitico_fornecedores():
     """Gera relatório analítico detalhado dos fornecedores"""
     try:
         # Get estabelecimento_id from JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         
         # Parâmetros de filtro
@@ -1678,7 +1495,7 @@ def sincronizar_metricas_fornecedor(fornecedor_id):
 def get_inteligencia(id):
     """Retorna o dossiê avançado de inteligência do fornecedor"""
     try:
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
         
         fornecedor = Fornecedor.query.filter_by(id=id, estabelecimento_id=estabelecimento_id).first_or_404()
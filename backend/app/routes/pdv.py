@@ -27,6 +27,9 @@ from sqlalchemy import func
 from app.utils.smart_cache import get_cached_config, set_cached_config
 from app.utils.query_helpers import get_funcionario_safe, get_produto_safe, get_venda_safe, get_venda_itens_safe
 from app.decorators.plan_guards import normalize_plan
+from app.services.carrinho_service import CarrinhoConflito, CarrinhoService
+from app.services.venda_service import VendaService
+from app.utils.errors import VendaJaCanceladaError
 
 pdv_bp = Blueprint("pdv", __name__)
 
@@ -770,9 +773,27 @@ def finalizar_venda():
         estabelecimento = Estabelecimento.query.get(estab_id)
         is_saas_admin = funcionario_data.get("is_super_admin", False)
         
-        items = data.get("items", [])
+        # Carrinho do servidor (/api/vendas/pdv/ativo): itens e totais vêm do estado quente
+        carrinho = None
+        if data.get("carrinho_id"):
+            carrinho = CarrinhoService.obter(estab_id, data["carrinho_id"])
+            if carrinho is None or carrinho.status != "aberto":
+                return jsonify({"error": "Carrinho não encontrado"}), 404
+            if data.get("versao") is not None and int(data["versao"]) != carrinho.versao:
+                return jsonify({"error": "CARRINHO_DESATUALIZADO",
+                                "carrinho": CarrinhoService.serializar(carrinho)}), 409
+            for campo in ("subtotal", "desconto", "total"):
+                data.setdefault(campo, float(getattr(carrinho, campo) or 0))
+            data.setdefault("cliente_id", carrinho.cliente_id)
+            items = CarrinhoService.itens_para_venda(carrinho)
+        else:
+            items = data.get("items", [])
         if not items:
             return jsonify({"error": "Nenhum produto na venda"}), 400
+        try:
+            produto_ids = VendaService.ids_de_produto(items)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         # IDEMPOTÊNCIA (PDV offline): se esta venda já subiu antes (mesmo offline_uuid),
         # devolve a existente em vez de duplicar estoque/financeiro.
@@ -959,11 +980,15 @@ def finalizar_venda():
 
             itens_formatados_para_resposta = []
 
-            for item_data in items:
-                produto_id = item_data.get("id") or item_data.get("productId") or item_data.get("produto_id")
+            # Lock pessimista de todos os produtos numa consulta, em ordem de id
+            # (mesma ordem do cancelamento: vendas e estornos simultâneos dos
+            # mesmos SKUs se enfileiram em vez de entrar em deadlock)
+            produtos_travados = VendaService.travar_produtos(estab_id, produto_ids)
+
+            for item_data, produto_id in zip(items, produto_ids):
                 quantidade = to_decimal(item_data.get("quantity") or item_data.get("quantidade", 1), precision=3)
 
-                produto = db.session.query(Produto).with_for_update().get(produto_id)
+                produto = produtos_travados.get(produto_id)
                 if not produto:
                     db.session.rollback()
                     return jsonify({"error": f"Produto {produto_id} não encontrado"}), 404
@@ -1134,20 +1159,35 @@ def finalizar_venda():
                 )
                 db.session.add(nova_entrega)
 
+            if carrinho is not None:
+                CarrinhoService.encerrar(carrinho, nova_venda.id)
             db.session.commit()
 
             # Lógica de Emissão NFC-e Automática
             nfce_status = None
             nfce_mensagem = None
             nfce_chave = None
+            nfce_documento_id = None
+            nfce_numero = None
             if data.get("emitir_nfce"):
                 try:
-                    from app.services.fiscal.emissao_service import emitir_nfce
-                    doc_fiscal = emitir_nfce(nova_venda, estabelecimento, funcionario_data.get("id"))
+                    from app.services.fiscal.fila_emissao import FilaEmissaoNFCe
+                    if FilaEmissaoNFCe.ativa():
+                        # Cupom sai na hora; o caixa acompanha por /api/fiscal/documentos/<id>/status
+                        doc_fiscal = FilaEmissaoNFCe.enfileirar(nova_venda, estabelecimento, funcionario_data.get("id"))
+                    else:
+                        from app.services.fiscal.emissao_service import emitir_nfce
+                        doc_fiscal = emitir_nfce(nova_venda, estabelecimento, funcionario_data.get("id"))
                     nfce_status = doc_fiscal.status
                     nfce_chave = doc_fiscal.chave_acesso
+                    nfce_documento_id = doc_fiscal.id
+                    nfce_numero = doc_fiscal.numero
                     if nfce_status == "erro" or nfce_status == "rejeitado":
                         nfce_mensagem = doc_fiscal.motivo_rejeicao
+                    elif nfce_status == "fila":
+                        nfce_mensagem = "NFC-e na fila de emissão."
+                    elif nfce_status == "contingencia":
+                        nfce_mensagem = "NFC-e emitida em contingência (gateway indisponível)."
                     else:
                         nfce_mensagem = "NFC-e emitida com sucesso."
                 except Exception as e:
@@ -1164,11 +1204,16 @@ def finalizar_venda():
                     "total": float(total),
                     "nfce_status": nfce_status,
                     "nfce_mensagem": nfce_mensagem,
-                    "nfce_chave": nfce_chave
+                    "nfce_chave": nfce_chave,
+                    "nfce_documento_id": nfce_documento_id,
+                    "nfce_numero": nfce_numero
                 },
                 "message": "Venda finalizada com sucesso!"
             }), 201
 
+        except CarrinhoConflito as e:
+            db.session.rollback()
+            return jsonify({"error": "CARRINHO_DESATUALIZADO", "message": str(e)}), 409
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f"ERRO PDV: {str(e)}")
@@ -1313,34 +1358,9 @@ def cancelar_venda_pdv(venda_id):
         if venda.status == "cancelada":
             return jsonify({"error": "Venda já está cancelada"}), 400
         
-        # Cancelar venda
+        # Cancelar venda (estoque, pagamentos, fiado e cliente revertidos em lote)
         try:
-            venda.status = "cancelada"
-            venda.observacoes = f"{venda.observacoes}\n[CANCELADA] {motivo}"
-            
-            # Devolver produtos ao estoque
-            for item in venda.itens:
-                produto = Produto.query.with_for_update().get(item.produto_id)
-                
-                if produto:
-                    estoque_anterior = produto.quantidade
-                    produto.quantidade += item.quantidade
-                    
-                    # Registrar movimentação
-                    movimentacao = MovimentacaoEstoque(
-                        estabelecimento_id=venda.estabelecimento_id,
-                        produto_id=produto.id,
-                        tipo="entrada",
-                        quantidade=item.quantidade,
-                        quantidade_anterior=estoque_anterior,
-                        quantidade_atual=produto.quantidade,
-                        venda_id=venda.id,
-                        funcionario_id=funcionario.id,
-                        created_at=datetime.now(),
-                        motivo=f"Cancelamento venda {venda.codigo}"
-                    )
-                    db.session.add(movimentacao)
-            
+            VendaService.cancelar(venda, motivo, funcionario.id)
             db.session.commit()
             
             current_app.logger.info(f"🚫 Venda {venda.codigo} cancelada por {funcionario.nome}")
@@ -1355,6 +1375,9 @@ def cancelar_venda_pdv(venda_id):
                 }
             }), 200
             
+        except VendaJaCanceladaError:
+            db.session.rollback()
+            return jsonify({"error": "Venda já está cancelada"}), 400
         except Exception as e:
             db.session.rollback()
             raise e
@@ -1588,7 +1611,7 @@ def enviar_cupom_email():
         current_app.logger.info(f"[EMAIL] Endereco: {endereco_completo}")
         current_app.logger.info(f"[EMAIL] Logo: {'sim' if logo_base64 else 'nao'} ({len(logo_base64) if logo_base64 else 0} bytes)")
         
-        sucesso, erro_email = enviar_cupom_fiscal(dados_formatados, email_final)
+        sucesso, erro_email = enviar_cupom_fiscal(dados_formatados, email_final, venda_data.get("estabelecimento_id"))
         
         if sucesso:
             return jsonify({"success": True, "message": f"Cupom enviado para {email_final}!"}), 200
@@ -1762,7 +1785,7 @@ def imprimir_venda_html(venda_id):
         nome_cliente = cliente_data.get("nome") if cliente_data else "Consumidor Final"
 
         # Formatação de Moeda e Data (Padrão Elite)
-        from app.services.email_service import _format_moeda, render_template_string
+        from app.services.email_service import _format_moeda
         
         data_venda = venda_data.get("data_venda")
         data_str = data_venda.strftime("%d/%m/%Y %H:%M:%S") if hasattr(data_venda, "strftime") else str(data_venda)
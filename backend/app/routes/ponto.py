@@ -9,7 +9,8 @@ from app.models import db, RegistroPonto, ConfiguracaoHorario, Funcionario, Esta
 from datetime import datetime, date, time, timedelta
 from sqlalchemy import func, and_, or_
 from app.decorators.plan_guards import plan_required, permission_required
-import base64
+from app.services.midia_service import MidiaService
+from app.services.ponto_diario_service import PontoDiarioService, dias_uteis
 import os
 from werkzeug.utils import secure_filename
 import logging
@@ -111,62 +112,6 @@ def _resolver_datahora_local(payload):
     return _agora_brasil()
 
 
-def salvar_foto_base64(foto_base64, funcionario_id):
-    """Salva foto em base64 e retorna o caminho"""
-    try:
-        if not foto_base64:
-            logger.warning("Foto vazia recebida")
-            return None
-        
-        # Verificar se é base64 com data URL
-        if not foto_base64.startswith('data:image'):
-            logger.error(f"Foto não é data URL válida. Começa com: {foto_base64[:50]}")
-            return None
-
-        # 1) PERSISTENTE: Cloudinary (se configurado). O disco do Render é EFÊMERO —
-        # fotos salvas localmente somem a cada deploy. Com CLOUDINARY_URL no ambiente,
-        # subimos para a nuvem e devolvemos uma URL permanente (CDN).
-        if os.getenv("CLOUDINARY_URL"):
-            try:
-                import cloudinary.uploader  # o SDK lê CLOUDINARY_URL do ambiente
-                result = cloudinary.uploader.upload(
-                    foto_base64,
-                    folder="mercadinhosys/pontos",
-                    public_id=f"ponto_{funcionario_id}_{_agora_brasil().strftime('%Y%m%d_%H%M%S')}",
-                    resource_type="image",
-                )
-                url = result.get("secure_url")
-                if url:
-                    return url
-                logger.warning("Cloudinary não retornou secure_url; usando disco local.")
-            except Exception as cloud_err:
-                logger.error(f"Upload Cloudinary falhou (fallback p/ disco): {cloud_err}")
-
-        # 2) FALLBACK: disco local (ok no dev; em produção SEM Cloudinary a imagem
-        # some no próximo deploy do Render).
-        # Extrair dados da imagem
-        header, encoded = foto_base64.split(',', 1)
-        ext = header.split('/')[1].split(';')[0]
-        
-        # Criar nome do arquivo (timestamp no fuso local, p/ casar com a hora do registro)
-        timestamp = _agora_brasil().strftime('%Y%m%d_%H%M%S')
-        filename = f"ponto_{funcionario_id}_{timestamp}.{ext}"
-        
-        # Criar diretório se não existir
-        upload_dir = os.path.join('uploads', 'pontos')
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Salvar arquivo
-        filepath = os.path.join(upload_dir, filename)
-        with open(filepath, 'wb') as f:
-            f.write(base64.b64decode(encoded))
-        
-        return f"/uploads/pontos/{filename}"
-    except Exception as e:
-        logger.error(f"Erro ao salvar foto: {e}")
-        return None
-
-
 def calcular_distancia_haversine(lat1, lon1, lat2, lon2):
     """Calcula distância entre dois pontos usando Haversine (em metros)"""
     try:
@@ -305,12 +250,15 @@ def registrar_ponto():
         if minutos_atraso > 0:
             status = 'atrasado'
         
-        # Salvar foto se fornecida
-        foto_url = None
+        # Foto vai para o spool do pipeline de mídia: WebP e upload saem em background
+        midia = None
         if data.get('foto'):
-            logger.info(f"📸 Salvando foto para funcionário {funcionario.id}")
-            foto_url = salvar_foto_base64(data.get('foto'), funcionario.id)
-            logger.info(f"📸 Foto salva: {foto_url}")
+            try:
+                midia = MidiaService.receber_base64(
+                    data.get('foto'), "pontos", f"ponto_{funcionario.id}", funcionario.estabelecimento_id
+                )
+            except ValueError as e:
+                logger.error(f"Foto do ponto descartada: {e}")
         
         # Criar registro
         registro = RegistroPonto(
@@ -322,7 +270,6 @@ def registrar_ponto():
             latitude=data.get('latitude'),
             longitude=data.get('longitude'),
             localizacao_endereco=data.get('localizacao_endereco'),
-            foto_url=foto_url,
             dispositivo=data.get('dispositivo'),
             ip_address=request.remote_addr,
             observacao=data.get('observacao'),
@@ -331,7 +278,15 @@ def registrar_ponto():
         )
         
         db.session.add(registro)
+        if midia:
+            MidiaService.vincular(midia, registro, "foto_url")
+        PontoDiarioService.recalcular_dia(
+            funcionario.id, funcionario.estabelecimento_id, hoje,
+            jornada_min=config.jornada_diaria_minutos if config and config.jornada_diaria_minutos else None,
+        )
         db.session.commit()
+        if midia:
+            MidiaService.despachar(midia)
         
         # Auditoria SaaS
         try:
@@ -557,114 +512,53 @@ def admin_todos_pontos():
 @jwt_required()
 @permission_required('ponto')
 def estatisticas_ponto():
-    """Retorna estatísticas de frequência do funcionário"""
+    """Retorna estatísticas de frequência do funcionário (consolidado diário, sem varrer batidas)"""
+    vazio = {
+        'dias_trabalhados': 0,
+        'total_atrasos': 0,
+        'minutos_atraso_total': 0,
+        'frequencia_tipo': {'entrada': 0, 'saida_almoco': 0, 'retorno_almoco': 0, 'saida': 0},
+        'grafico_frequencia': [],
+        'taxa_presenca': 0
+    }
     try:
         funcionario = get_funcionario_logado()
         if not funcionario:
             return jsonify({'success': False, 'message': 'Funcionário não encontrado'}), 404
         
         # Últimos 30 dias
-        data_inicio = date.today() - timedelta(days=30)
-        
-        try:
-            registros = RegistroPonto.query.filter(
-                and_(
-                    RegistroPonto.funcionario_id == funcionario.id,
-                    RegistroPonto.data >= data_inicio
-                )
-            ).all()
-        except Exception as e:
-            logger.error(f"Erro ao buscar registros de ponto: {e}")
-            return jsonify({
-                'success': True,
-                'data': {
-                    'dias_trabalhados': 0,
-                    'total_atrasos': 0,
-                    'minutos_atraso_total': 0,
-                    'frequencia_tipo': {'entrada': 0, 'saida_almoco': 0, 'retorno_almoco': 0, 'saida': 0},
-                    'grafico_frequencia': [],
-                    'taxa_presenca': 0
-                }
-            }), 200
-        
-        # Agrupar por data
-        registros_por_dia = {}
-        for r in registros:
-            try:
-                data_str = r.data.isoformat() if r.data else None
-                if data_str and data_str not in registros_por_dia:
-                    registros_por_dia[data_str] = []
-                if data_str:
-                    registros_por_dia[data_str].append(r)
-            except Exception as e:
-                logger.error(f"Erro ao processar registro {r.id}: {e}")
-                continue
-        
-        # Calcular estatísticas com tratamento de erro
-        dias_trabalhados = len(registros_por_dia)
-        total_atrasos = 0
-        minutos_atraso_total = 0
-        
-        for r in registros:
-            try:
-                if hasattr(r, 'status') and r.status == 'atrasado':
-                    total_atrasos += 1
-                if hasattr(r, 'minutos_atraso') and r.minutos_atraso:
-                    minutos_atraso_total += r.minutos_atraso
-            except Exception:
-                pass
-        
-        # Frequência por tipo
-        frequencia_tipo = {
-            'entrada': 0,
-            'saida_almoco': 0,
-            'retorno_almoco': 0,
-            'saida': 0
-        }
+        hoje = date.today()
+        data_inicio = hoje - timedelta(days=30)
         
-        for r in registros:
-            try:
-                if hasattr(r, 'tipo_registro') and r.tipo_registro in frequencia_tipo:
-                    frequencia_tipo[r.tipo_registro] += 1
-            except Exception:
-                pass
+        ids = [funcionario.id]
+        totais = PontoDiarioService.totais(funcionario.estabelecimento_id, data_inicio, hoje, ids)
+        por_dia = PontoDiarioService.serie_diaria(funcionario.estabelecimento_id, hoje - timedelta(days=29), hoje, ids)
         
         # Gráfico de frequência (últimos 30 dias)
         grafico_frequencia = []
         for i in range(30):
-            try:
-                dia = date.today() - timedelta(days=29-i)
-                dia_str = dia.isoformat()
-                registros_dia = registros_por_dia.get(dia_str, [])
-                
-                minutos_atraso_dia = 0
-                teve_atraso_dia = False
-                for r in registros_dia:
-                    try:
-                        if hasattr(r, 'status') and r.status == 'atrasado':
-                            teve_atraso_dia = True
-                        if hasattr(r, 'minutos_atraso') and r.minutos_atraso:
-                            minutos_atraso_dia += r.minutos_atraso
-                    except Exception:
-                        pass
-                
-                grafico_frequencia.append({
-                    'data': dia_str,
-                    'total_registros': len(registros_dia),
-                    'teve_atraso': teve_atraso_dia,
-                    'minutos_atraso': minutos_atraso_dia
-                })
-            except Exception as e:
-                logger.error(f"Erro ao processar dia {dia}: {e}")
-                continue
+            dia = hoje - timedelta(days=29 - i)
+            linha = por_dia.get(dia, {})
+            grafico_frequencia.append({
+                'data': dia.isoformat(),
+                'total_registros': linha.get('batidas', 0),
+                'teve_atraso': linha.get('batidas_atrasadas', 0) > 0,
+                'minutos_atraso': linha.get('minutos_atraso', 0)
+            })
         
+        dias_trabalhados = totais['dias']
         return jsonify({
             'success': True,
             'data': {
                 'dias_trabalhados': dias_trabalhados,
-                'total_atrasos': total_atrasos,
-                'minutos_atraso_total': minutos_atraso_total,
-                'frequencia_tipo': frequencia_tipo,
+                'total_atrasos': totais['batidas_atrasadas'],
+                'minutos_atraso_total': totais['minutos_atraso'],
+                'frequencia_tipo': {
+                    'entrada': totais['entradas'],
+                    'saida_almoco': totais['saidas_almoco'],
+                    'retorno_almoco': totais['retornos_almoco'],
+                    'saida': totais['saidas']
+                },
                 'grafico_frequencia': grafico_frequencia,
                 'taxa_presenca': round((dias_trabalhados / 30) * 100, 1) if dias_trabalhados > 0 else 0
             }
@@ -672,19 +566,8 @@ def estatisticas_ponto():
         
     except Exception as e:
         logger.error(f"Erro ao calcular estatísticas: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'success': True,
-            'data': {
-                'dias_trabalhados': 0,
-                'total_atrasos': 0,
-                'minutos_atraso_total': 0,
-                'frequencia_tipo': {'entrada': 0, 'saida_almoco': 0, 'retorno_almoco': 0, 'saida': 0},
-                'grafico_frequencia': [],
-                'taxa_presenca': 0
-            }
-        }), 200
+        db.session.rollback()
+        return jsonify({'success': True, 'data': vazio}), 200
 
 
 @ponto_bp.route('/configuracao', methods=['GET'])
@@ -761,10 +644,14 @@ def atualizar_configuracao():
         # Jornada diária normal (CLT: 8h/dia por padrão). Contratos com
         # jornada diferente (ex.: 9h para bater 44h/semana na escala 6x1)
         # configuram aqui — o que passar disso vira hora extra no dia.
+        jornada_anterior = config.jornada_diaria_minutos
         if 'jornada_diaria_minutos' in data:
             config.jornada_diaria_minutos = int(data['jornada_diaria_minutos'])
         elif 'jornada_diaria_horas' in data:
             config.jornada_diaria_minutos = int(round(float(data['jornada_diaria_horas']) * 60))
+        if config.jornada_diaria_minutos and config.jornada_diaria_minutos != jornada_anterior:
+            # Hora extra do consolidado diário segue a jornada vigente
+            PontoDiarioService.reaplicar_jornada(config.estabelecimento_id, config.jornada_diaria_minutos)
 
         if 'exigir_foto' in data:
             config.exigir_foto = data['exigir_foto']
@@ -854,6 +741,7 @@ def ajustar_ponto(registro_id):
             registro.minutos_atraso = int(data['minutos_atraso'])
         
         registro.updated_at = datetime.now(timezone.utc)
+        PontoDiarioService.recalcular_dia(registro.funcionario_id, registro.estabelecimento_id, registro.data)
         db.session.commit()
         
         logger.info(f"✅ Ponto ajustado: {registro.funcionario.nome} - {registro.data} {registro.hora}")
@@ -907,43 +795,32 @@ def relatorio_funcionarios():
             ativo=True
         ).all()
         
+        # Um GROUP BY no consolidado diário para todos os funcionários
+        resumo = PontoDiarioService.resumo_por_funcionario(
+            funcionario.estabelecimento_id, data_inicio_obj, data_fim_obj, [f.id for f in funcionarios]
+        )
+        uteis = dias_uteis(data_inicio_obj, data_fim_obj)  # Segunda a sexta
+        
         relatorio = []
         
         for func in funcionarios:
-            # Buscar registros do período
-            registros = RegistroPonto.query.filter(
-                and_(
-                    RegistroPonto.funcionario_id == func.id,
-                    RegistroPonto.data >= data_inicio_obj,
-                    RegistroPonto.data <= data_fim_obj
-                )
-            ).all()
-            
-            # Calcular estatísticas
-            dias_trabalhados = len(set(r.data for r in registros))
-            total_atrasos = sum(1 for r in registros if r.status == 'atrasado')
-            minutos_atraso_total = sum(r.minutos_atraso for r in registros)
-            
-            # Calcular dias úteis no período
-            dias_uteis = 0
-            data_atual = data_inicio_obj
-            while data_atual <= data_fim_obj:
-                if data_atual.weekday() < 5:  # Segunda a sexta
-                    dias_uteis += 1
-                data_atual += timedelta(days=1)
-            
-            taxa_presenca = round((dias_trabalhados / dias_uteis * 100), 1) if dias_uteis > 0 else 0
+            totais = resumo.get(func.id, {})
+            dias_trabalhados = totais.get('dias', 0)
+            taxa_presenca = round((dias_trabalhados / uteis * 100), 1) if uteis > 0 else 0
             
             relatorio.append({
                 'funcionario_id': func.id,
                 'funcionario_nome': func.nome,
                 'cargo': func.cargo,
                 'dias_trabalhados': dias_trabalhados,
-                'dias_uteis': dias_uteis,
+                'dias_uteis': uteis,
                 'taxa_presenca': taxa_presenca,
-                'total_atrasos': total_atrasos,
-                'minutos_atraso_total': minutos_atraso_total,
-                'total_registros': len(registros)
+                'faltas': max(0, uteis - totais.get('dias_presentes', 0)),
+                'total_atrasos': totais.get('batidas_atrasadas', 0),
+                'minutos_atraso_total': totais.get('minutos_atraso', 0),
+                'minutos_trabalhados': totais.get('minutos_trabalhados', 0),
+                'minutos_extras': totais.get('minutos_extras', 0),
+                'total_registros': totais.get('batidas', 0)
             })
         
         return jsonify({
@@ -952,7 +829,7 @@ def relatorio_funcionarios():
                 'periodo': {
                     'data_inicio': data_inicio,
                     'data_fim': data_fim,
-                    'dias_uteis': dias_uteis
+                    'dias_uteis': uteis
                 },
                 'funcionarios': relatorio,
                 'resumo': {
@@ -1013,33 +890,15 @@ def relatorio_detalhado_funcionario(funcionario_id):
                 registros_por_dia[data_str] = []
             registros_por_dia[data_str].append(r.to_dict())
         
-        # Calcular estatísticas
-        dias_trabalhados = len(registros_por_dia)
-        total_atrasos = sum(1 for r in registros if r.status == 'atrasado')
-        minutos_atraso_total = sum(r.minutos_atraso for r in registros)
-        
-        # Calcular horas trabalhadas por dia
-        horas_por_dia = []
-        for data_str, regs in registros_por_dia.items():
-            entrada = next((r for r in regs if r['tipo_registro'] == 'entrada'), None)
-            saida = next((r for r in regs if r['tipo_registro'] == 'saida'), None)
-            
-            horas_trabalhadas = 0
-            if entrada and saida:
-                entrada_time = datetime.strptime(entrada['hora'], '%H:%M:%S').time()
-                saida_time = datetime.strptime(saida['hora'], '%H:%M:%S').time()
-                
-                entrada_dt = datetime.combine(date.today(), entrada_time)
-                saida_dt = datetime.combine(date.today(), saida_time)
-                
-                diferenca = saida_dt - entrada_dt
-                horas_trabalhadas = diferenca.total_seconds() / 3600
-            
-            horas_por_dia.append({
-                'data': data_str,
-                'horas_trabalhadas': round(horas_trabalhadas, 2),
-                'registros': regs
-            })
+        # Estatísticas e horas do dia vêm do consolidado (mesma regra do espelho: desconta o almoço)
+        dias = {d.data.isoformat(): d for d in PontoDiarioService.dias(
+            [funcionario_id], data_inicio_obj, data_fim_obj, funcionario.estabelecimento_id)}
+        horas_por_dia = [{
+            'data': data_str,
+            'horas_trabalhadas': round((dias[data_str].minutos_trabalhados if data_str in dias else 0) / 60, 2),
+            'minutos_extras': dias[data_str].minutos_extras if data_str in dias else 0,
+            'registros': regs
+        } for data_str, regs in registros_por_dia.items()]
         
         return jsonify({
             'success': True,
@@ -1055,11 +914,12 @@ def relatorio_detalhado_funcionario(funcionario_id):
                     'data_fim': data_fim
                 },
                 'estatisticas': {
-                    'dias_trabalhados': dias_trabalhados,
-                    'total_atrasos': total_atrasos,
-                    'minutos_atraso_total': minutos_atraso_total,
+                    'dias_trabalhados': len(dias),
+                    'total_atrasos': sum(d.batidas_atrasadas for d in dias.values()),
+                    'minutos_atraso_total': sum(d.minutos_atraso for d in dias.values()),
                     'total_registros': len(registros),
-                    'horas_totais': round(sum(d['horas_trabalhadas'] for d in horas_por_dia), 2)
+                    'horas_totais': round(sum(d.minutos_trabalhados for d in dias.values()) / 60, 2),
+                    'minutos_extras': sum(d.minutos_extras for d in dias.values())
                 },
                 'registros_por_dia': horas_por_dia
             }
@@ -1119,6 +979,7 @@ def limpar_registros_teste():
         # Deletar registros
         for registro in registros:
             db.session.delete(registro)
+        PontoDiarioService.recalcular_dia(funcionario.id, funcionario.estabelecimento_id, hoje)
         
         db.session.commit()
         
@@ -10,10 +10,10 @@ from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment
 from datetime import datetime, date, timedelta
 from decimal import Decimal, ROUND_HALF_UP, DecimalException
 import re
-import os
 import math
+import json
 import requests  # proxy Cosmos (buscar_cosmos_gtin / catalogo_lookup) — sem isto o endpoint quebrava com NameError
-from sqlalchemy.orm import joinedload, selectinload, subqueryload
+from sqlalchemy.orm import aliased, joinedload, selectinload, subqueryload
 from app.models import (
     db,
     Produto,
@@ -34,7 +34,10 @@ from app.utils import calcular_margem_lucro, formatar_codigo_barras
 from app.decorators.decorator_jwt import funcionario_required
 from app.decorators.plan_guards import quota_required, permission_required
 from app.decorators.rbac import gerente_required, resource_required
+from app.services import catalogo_mestre_service as catalogo_mestre
 from app.services.catalogo_mestre_service import registrar_produto_se_novo
+from app.services.exportacao_service import Coluna, Exportacao, construir, gerar_csv, registrar_exportacao, responder
+from app.services.importacao_service import ImportacaoService, resposta as resposta_importacao, responder as responder_importacao
 from app.services.view_schema_service import (
     inferir_perfil_fiscal_padrao,
     mix_permitido_para_estabelecimento,
@@ -400,6 +403,248 @@ def verificar_validade_proxima(produto):
     return False
 
 
+def aplicar_filtros_produtos(query, args, estabelecimento_id):
+    """Filtros da listagem de produtos (GET /api/produtos) sobre `query`.
+
+    Serve tanto à Query ORM da listagem quanto ao select só de colunas da
+    exportação — a exportação respeita exatamente os mesmos parâmetros.
+    Os baldes de giro calculados em Python (giro_rapido/normal/lento) ficam
+    de fora: são resolvidos pela listagem."""
+    # O frontend envia "ativos" (productsService); aceita também "ativo"
+    # (legado). Antes só "ativo" era lido e o filtro era ignorado em
+    # silêncio — a lista mostrava inativos enquanto os cards contavam
+    # só ativos.
+    ativo = args.get("ativos", args.get("ativo"))
+    categoria = args.get("categoria")
+    fornecedor_id = args.get("fornecedor_id", type=int)
+    estoque_status = args.get("estoque_status") # baixo, esgotado, normal
+    tipo = args.get("tipo")
+    preco_min = args.get("preco_min", type=float)
+    preco_max = args.get("preco_max", type=float)
+    busca = args.get("busca", "", type=str).strip()
+    filtro_rapido = args.get("filtro_rapido", None, type=str)
+    filtro_alerta = args.get("alerta")
+
+    # Filtro de Tenant OBRIGATÓRIO (Zero Leak)
+    if str(estabelecimento_id).lower() != 'all':
+        query = query.filter(Produto.estabelecimento_id == estabelecimento_id)
+
+    # Filtros de validade lidos aqui (antes dos aliases) para o alias
+    # "validade" funcionar — antes ele setava uma variável local que era
+    # sobrescrita pela releitura do request mais abaixo.
+    validade_proxima = args.get("validade_proxima")
+    dias_validade = args.get("dias_validade", 30, type=int)
+    vencidos = args.get("vencidos")
+
+    # Alias de filtros de alerta
+    if filtro_alerta == "baixo_estoque":
+        estoque_status = "baixo"
+    elif filtro_alerta == "validade":
+        validade_proxima = "true"
+
+    # 1. Filtro de Ativo/Inativo
+    if ativo is not None:
+        is_ativo = ativo.lower() == "true"
+        query = query.filter(Produto.ativo == is_ativo)
+
+    # 2. Filtro de Categoria
+    if categoria:
+        query = query.join(CategoriaProduto).filter(CategoriaProduto.nome == categoria)
+
+    # 3. Filtro de Fornecedor
+    if fornecedor_id:
+        query = query.filter(Produto.fornecedor_id == fornecedor_id)
+
+    # 4. Filtro de Tipo (se existir no modelo, assumindo que sim ou usando categoria como proxy se necessário)
+    if tipo:
+        # Se houver campo 'tipo' ou usar categoria/subcategoria
+         query = query.filter(Produto.tipo == tipo)
+
+    # 5. Filtro de Preço
+    if preco_min is not None:
+        query = query.filter(Produto.preco_venda >= preco_min)
+    if preco_max is not None:
+        query = query.filter(Produto.preco_venda <= preco_max)
+
+    # 6. Filtro de Status de Estoque
+    if estoque_status:
+        if estoque_status == "esgotado":
+            query = query.filter(Produto.quantidade <= 0)
+        elif estoque_status == "baixo":
+            query = query.filter(Produto.quantidade <= Produto.quantidade_minima)
+        elif estoque_status == "normal":
+            query = query.filter(Produto.quantidade > Produto.quantidade_minima)
+
+    # 7. Busca Textual
+    if busca:
+        busca_termo = f"%{busca}%"
+        query = query.filter(
+            or_(
+                ilike_unaccent(Produto.nome, busca_termo),
+                ilike_unaccent(Produto.codigo_barras, busca_termo),
+                ilike_unaccent(Produto.codigo_interno, busca_termo),
+                ilike_unaccent(Produto.descricao, busca_termo),
+                ilike_unaccent(Produto.marca, busca_termo),
+            )
+        )
+
+    # 8. Filtros de Validade (produto OU lotes do produto; fallback só por produto se lotes falhar)
+    hoje = date.today()
+
+    try:
+        if validade_proxima and validade_proxima.lower() == "true":
+            limite = hoje + timedelta(days=dias_validade)
+            cond_produto = and_(
+                Produto.data_validade.isnot(None),
+                Produto.data_validade >= hoje,
+                Produto.data_validade <= limite,
+            )
+            subq_lotes = db.session.query(ProdutoLote.produto_id).filter(
+                ProdutoLote.ativo == True,
+                ProdutoLote.quantidade > 0,
+                ProdutoLote.data_validade >= hoje,
+                ProdutoLote.data_validade <= limite,
+            )
+            if str(estabelecimento_id).lower() != 'all':
+                subq_lotes = subq_lotes.filter(ProdutoLote.estabelecimento_id == estabelecimento_id)
+            
+            subq_lotes = subq_lotes.distinct()
+            query = query.filter(or_(cond_produto, Produto.id.in_(subq_lotes)))
+        if vencidos and vencidos.lower() == "true":
+            cond_produto = and_(
+                Produto.quantidade > 0,
+                Produto.data_validade.isnot(None),
+                Produto.data_validade < hoje,
+            )
+            subq_lotes = (
+                db.session.query(ProdutoLote.produto_id)
+                .filter(
+                    ProdutoLote.estabelecimento_id == estabelecimento_id,
+                    ProdutoLote.ativo == True,
+                    ProdutoLote.quantidade > 0,
+                    ProdutoLote.data_validade < hoje,
+                )
+                .distinct()
+            )
+            query = query.filter(or_(cond_produto, Produto.id.in_(subq_lotes)))
+    except Exception:
+        # Fallback: filtrar só por data_validade do produto (sem lotes)
+        if validade_proxima and validade_proxima.lower() == "true":
+            dias = args.get("dias_validade", 30, type=int)
+            limite = hoje + timedelta(days=dias)
+            query = query.filter(Produto.quantidade > 0)
+            query = query.filter(Produto.data_validade.isnot(None))
+            query = query.filter(Produto.data_validade >= hoje, Produto.data_validade <= limite)
+        if vencidos and vencidos.lower() == "true":
+            query = query.filter(Produto.quantidade > 0)
+            query = query.filter(Produto.data_validade.isnot(None))
+            query = query.filter(Produto.data_validade < hoje)
+
+    # Filtro rápido por margem (Alta Margem >50%, Baixa Margem <30%)
+    if filtro_rapido == "margem_alta":
+        query = query.filter(Produto.margem_lucro >= 50)
+    elif filtro_rapido == "margem_baixa":
+        query = query.filter(Produto.margem_lucro < 30)
+    elif filtro_rapido in ("classe_a", "classe_b", "classe_c"):
+        # Classificação ABC DINÂMICA (por faturamento real), consistente com os
+        # contadores do dashboard. Evita depender da coluna gravada (que pode estar
+        # desatualizada/NULL e fazia o filtro voltar vazio).
+        if str(estabelecimento_id).lower() != "all":
+            # Janela móvel de 90 dias, cacheada por tenant — MESMA fonte que os
+            # cards/estatísticas usam. Antes recalculava ~10 anos de vendas a
+            # cada request (principal causa de lentidão do filtro).
+            from app.utils.abc_cache import get_classificacoes_abc
+            classificacoes = get_classificacoes_abc(estabelecimento_id)
+            ids_com_venda = list(classificacoes.keys())
+            if filtro_rapido == "classe_a":
+                ids_a = [pid for pid, c in classificacoes.items() if c == "A"]
+                query = query.filter(Produto.id.in_(ids_a if ids_a else [-1]))
+            elif filtro_rapido == "classe_b":
+                ids_b = [pid for pid, c in classificacoes.items() if c == "B"]
+                query = query.filter(Produto.id.in_(ids_b if ids_b else [-1]))
+            else:
+                # Encalhados = classe C por faturamento + produtos sem nenhuma venda no período.
+                ids_c = [pid for pid, c in classificacoes.items() if c == "C"]
+                if ids_com_venda:
+                    query = query.filter(or_(Produto.id.in_(ids_c if ids_c else [-1]),
+                                             ~Produto.id.in_(ids_com_venda)))
+                # Sem nenhuma venda no tenant: todos são encalhados → não aplica filtro extra.
+        else:
+            alvo = "A" if filtro_rapido == "classe_a" else ("B" if filtro_rapido == "classe_b" else "C")
+            query = query.filter(func.upper(Produto.classificacao_abc) == alvo)
+    elif filtro_rapido == "repor_urgente":
+        query = query.filter(
+            or_(
+                Produto.quantidade == 0,
+                Produto.quantidade <= Produto.quantidade_minima
+            )
+        )
+    # NOTA: giro_rapido/normal/lento NÃO são filtrados aqui em SQL.
+    # São resolvidos em Python via classificar_giro_produto() (cobertura/VMD),
+    # a MESMA função usada pelos contadores do dashboard — garantindo que o
+    # número do card e a quantidade exibida na lista/modal sejam idênticos.
+
+    # Filtro por Classificação ABC (drill-down do dashboard)
+    classificacao_abc = args.get("classificacao_abc")
+    if classificacao_abc:
+        query = query.filter(func.upper(Produto.classificacao_abc) == classificacao_abc.upper())
+
+    # Filtro por Giro de Estoque (drill-down do dashboard)
+    # rapido/estrela: alto volume vendido | lento: vende pouco | parado: não vende
+    giro = args.get("giro")
+    if giro:
+        g = giro.lower()
+        if g in ("rapido", "estrela", "alto"):
+            query = query.filter(Produto.quantidade_vendida >= 30)
+        elif g in ("lento", "baixo"):
+            query = query.filter(
+                Produto.quantidade_vendida > 0,
+                Produto.quantidade_vendida < 30,
+            )
+        elif g in ("parado", "encalhado"):
+            query = query.filter(
+                or_(Produto.quantidade_vendida == 0, Produto.quantidade_vendida.is_(None)),
+                Produto.quantidade > 0,
+            )
+    return query
+
+
+def ordenar_produtos(query, ordenar_por, direcao):
+    """Ordenação da listagem de produtos (whitelist de colunas)."""
+    # Whitelist de colunas permitidas para evitar UndefinedColumn no Postgres
+    COLUNAS_ORDENACAO_VALIDAS = {
+        "nome": Produto.nome,
+        "preco_venda": Produto.preco_venda,
+        "preco_custo": Produto.preco_custo,
+        "precocusto": Produto.preco_custo, # Handle typo
+        "quantidade": Produto.quantidade,
+        "categoria": Produto.categoria_id,
+        "atualizado": Produto.updated_at,
+        "margem_lucro": Produto.margem_lucro,
+        "valor_total_estoque": func.coalesce(Produto.preco_custo * Produto.quantidade, 0),
+        # Ordenações usadas pelos filtros rápidos e pelo modal de filtros
+        # avançados — estavam fora da whitelist e caíam em silêncio para
+        # "nome" (o usuário pedia "mais vendidos" e recebia ordem alfabética).
+        "total_vendido": Produto.total_vendido,
+        "quantidade_vendida": Produto.quantidade_vendida,
+        "ultima_venda": Produto.ultima_venda,
+        "data_validade": Produto.data_validade,
+    }
+
+    # Colunas nullable: produto nunca vendido / sem validade sempre por
+    # último, em qualquer direção — senão o "top vendidos desc" começava
+    # com uma página de NULLs no Postgres.
+    _COLUNAS_NULLABLE = {"total_vendido", "quantidade_vendida", "ultima_venda", "data_validade", "margem_lucro"}
+
+    coluna_ordenacao = COLUNAS_ORDENACAO_VALIDAS.get(ordenar_por, Produto.nome)
+
+    ordem = coluna_ordenacao.desc() if direcao == "desc" else coluna_ordenacao.asc()
+    if ordenar_por in _COLUNAS_NULLABLE:
+        ordem = ordem.nullslast()
+    query = query.order_by(ordem, Produto.id.asc())
+    return query
+
+
 # ============================================
 # ROTAS DE PRODUTOS
 # ============================================
@@ -414,69 +659,49 @@ def buscar_cosmos_gtin(gtin):
     """
     Consulta o banco de dados geral do Cosmos através do GTIN.
     Atua como um proxy para evitar exposição do Token no frontend e contornar CORS.
+    O que o catálogo mestre já tem (ou o 404 recente em cache) não vai à rede.
     """
-    token = os.environ.get("COSMOS_TOKEN") or "MVsiut1dwhg12WGhPuTD9Q"
-    url = f"https://api.cosmos.bluesoft.com.br/gtins/{gtin}.json"
-    
-    headers = {
-        'X-Cosmos-Token': token,
-        'Content-Type': 'application/json',
-        'User-Agent': 'Cosmos-API-Request'
-    }
-    
+    entrada = catalogo_mestre.buscar_ean(gtin)
+    if entrada and entrada["status"] in ("nao_encontrado", catalogo_mestre.AUSENTE):
+        return jsonify({"success": False, "message": "Produto não encontrado no Cosmos"}), 404
+    if entrada and entrada.get("fonte") == "cosmos":
+        payload = db.session.execute(
+            db.select(CatalogoMestre.payload_json).where(CatalogoMestre.ean == gtin)
+        ).scalar()
+        if payload:
+            return jsonify(json.loads(payload))
+
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        status, j, _ = catalogo_mestre.consultar_cosmos(gtin)
         
-        if response.status_code == 200:
-            return jsonify(response.json())
-        elif response.status_code == 404:
+        if status == 200:
+            try:
+                item = catalogo_mestre.gravar_cosmos(gtin, j)
+                db.session.commit()
+                catalogo_mestre.lembrar(item)
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.warning(f"Cosmos: resposta não gravada no catálogo ({gtin}): {e}")
+            return jsonify(j)
+        elif status == 404:
+            catalogo_mestre.lembrar_ausente(gtin)
             return jsonify({"success": False, "message": "Produto não encontrado no Cosmos"}), 404
-        elif response.status_code == 429:
+        elif status == 429:
             return jsonify({"success": False, "message": "Limite de requisições excedido no Cosmos"}), 429
         else:
-            return jsonify({"success": False, "message": f"Erro na API Cosmos: {response.status_code}"}), response.status_code
+            return jsonify({"success": False, "message": f"Erro na API Cosmos: {status}"}), status
             
     except requests.exceptions.RequestException as e:
         current_app.logger.error(f"Erro ao conectar com API Cosmos: {str(e)}")
         return jsonify({"success": False, "message": "Erro de conexão com o serviço Cosmos"}), 502
 
 
-def _cosmos_para_catalogo(ean: str, j: dict) -> "CatalogoMestre":
-    """Mapeia o JSON do Cosmos para o CatalogoMestre e faz upsert (cache global)."""
-    import json as _json
-    brand = (j.get("brand") or {}) if isinstance(j.get("brand"), dict) else {}
-    ncm = (j.get("ncm") or {}) if isinstance(j.get("ncm"), dict) else {}
-    cat = (j.get("category") or {}) if isinstance(j.get("category"), dict) else {}
-    gpc = (j.get("gpc") or {}) if isinstance(j.get("gpc"), dict) else {}
-    preco = j.get("avg_price") or j.get("price") or None
-    try:
-        preco = float(preco) if preco not in (None, "", "0") else None
-    except (TypeError, ValueError):
-        preco = None
-
-    item = CatalogoMestre.query.filter_by(ean=ean).first()
-    if not item:
-        item = CatalogoMestre(ean=ean)
-        db.session.add(item)
-    item.nome = j.get("description") or item.nome
-    item.marca = brand.get("name") or item.marca
-    item.ncm = (ncm.get("code") or item.ncm or "")[:8] or None
-    item.categoria = cat.get("name") or gpc.get("description") or item.categoria
-    item.imagem_url = j.get("thumbnail") or item.imagem_url
-    item.preco_referencia = preco if preco is not None else item.preco_referencia
-    item.fonte = "cosmos"
-    item.status = "encontrado"
-    item.payload_json = _json.dumps(j)[:60000]
-    item.consultado_em = datetime.utcnow()
-    return item
-
-
 @produtos_bp.route("/catalogo/lookup/<ean>", methods=["GET"])
 @funcionario_required
 def catalogo_lookup(ean):
     """
     Lookup inteligente por EAN para o cadastro rápido (câmera/leitor):
-      1) tenta o Catálogo Mestre local (NÃO consome quota Cosmos);
+      1) tenta o Catálogo Mestre (cache → banco; NÃO consome quota Cosmos);
       2) no miss, consulta o Cosmos e GRAVA no catálogo (cresce sozinho);
       3) erros transparentes: distingue não-encontrado, quota e conexão.
 
@@ -491,35 +716,33 @@ def catalogo_lookup(ean):
     force = request.args.get("force", "false").lower() == "true"
 
     # 1) Catálogo local
-    item = None
     if not force:
-        item = CatalogoMestre.query.filter_by(ean=ean_limpo, status="encontrado").first()
-        if item:
-            return jsonify({"success": True, "source": "catalogo", "data": item.to_dict()}), 200
+        entrada = catalogo_mestre.buscar_ean(ean_limpo)
+        if entrada and entrada["status"] == "encontrado":
+            return jsonify({"success": True, "source": "catalogo", "data": entrada}), 200
         # Cache negativo: EAN já consultado e inexistente NÃO reconsulta o Cosmos
         # (economiza quota, que é limitada — ver tratamento de 429 abaixo). O
         # usuário pode forçar um refresh com ?force=true caso o Cosmos atualize.
-        negativo = CatalogoMestre.query.filter_by(ean=ean_limpo, status="nao_encontrado").first()
-        if negativo:
+        if entrada and entrada["status"] == "nao_encontrado":
             return jsonify({"success": False, "source": "catalogo", "code": "nao_encontrado",
                             "message": "EAN já consultado e ausente na base. Preencha manualmente ou use ?force=true."}), 404
+        if entrada and entrada["status"] == catalogo_mestre.AUSENTE:
+            return jsonify({"success": False, "source": "cache", "code": "nao_encontrado",
+                            "message": "Este EAN não existe na base Cosmos. Preencha os dados manualmente."}), 404
 
     # 2) Fallback Cosmos (se não encontrou localmente, ou se forçou)
-    token = os.environ.get("COSMOS_TOKEN") or "MVsiut1dwhg12WGhPuTD9Q"
-    url = f"https://api.cosmos.bluesoft.com.br/gtins/{ean_limpo}.json"
-    headers = {"X-Cosmos-Token": token, "Content-Type": "application/json", "User-Agent": "Cosmos-API-Request"}
     try:
-        resp = requests.get(url, headers=headers, timeout=10)
+        status, j, _ = catalogo_mestre.consultar_cosmos(ean_limpo)
     except requests.exceptions.RequestException as e:
         current_app.logger.error(f"Cosmos lookup falha de conexão ({ean_limpo}): {e}")
         return jsonify({"success": False, "code": "conexao",
                         "message": "Sem conexão com o Cosmos no momento. Tente novamente ou preencha manualmente."}), 502
 
-    if resp.status_code == 200:
+    if status == 200:
         try:
-            j = resp.json()
-            item = _cosmos_para_catalogo(ean_limpo, j)
+            item = catalogo_mestre.gravar_cosmos(ean_limpo, j)
             db.session.commit()
+            catalogo_mestre.lembrar(item)
             return jsonify({"success": True, "source": "cosmos", "data": item.to_dict()}), 200
         except Exception as e:
             db.session.rollback()
@@ -527,23 +750,25 @@ def catalogo_lookup(ean):
             return jsonify({"success": False, "code": "erro_interno",
                             "message": "Produto encontrado, mas houve erro ao salvar no catálogo."}), 500
 
-    if resp.status_code == 404:
-        # Não gravamos cache negativo para permitir que o usuário cadastre manualmente 
-        # sem ser bloqueado em consultas futuras caso a API do Cosmos seja atualizada.
+    if status == 404:
+        # Não gravamos no catálogo para permitir que o usuário cadastre manualmente
+        # sem ser bloqueado em consultas futuras caso a API do Cosmos seja atualizada;
+        # o negativo fica só no cache, com expiração.
+        catalogo_mestre.lembrar_ausente(ean_limpo)
         return jsonify({"success": False, "code": "nao_encontrado",
                         "message": "Este EAN não existe na base Cosmos. Preencha os dados manualmente."}), 404
 
-    if resp.status_code in (401, 403):
-        current_app.logger.error(f"Cosmos token inválido/expirado (HTTP {resp.status_code}).")
+    if status in (401, 403):
+        current_app.logger.error(f"Cosmos token inválido/expirado (HTTP {status}).")
         return jsonify({"success": False, "code": "token",
                         "message": "Token do Cosmos inválido ou expirado. Configure um COSMOS_TOKEN válido."}), 502
-    if resp.status_code == 429:
+    if status == 429:
         return jsonify({"success": False, "code": "quota",
                         "message": "Limite diário de consultas do Cosmos atingido. Use um token próprio (COSMOS_TOKEN) ou tente amanhã."}), 429
 
-    current_app.logger.error(f"Cosmos lookup HTTP {resp.status_code} para {ean_limpo}.")
+    current_app.logger.error(f"Cosmos lookup HTTP {status} para {ean_limpo}.")
     return jsonify({"success": False, "code": "api",
-                    "message": f"Cosmos respondeu erro {resp.status_code}. Tente novamente em instantes."}), 502
+                    "message": f"Cosmos respondeu erro {status}. Tente novamente em instantes."}), 502
 
 
 # ============================================
@@ -558,10 +783,10 @@ def catalogo_buscar_ean(ean):
     Usado no cadastro rápido: preenche nome, marca, NCM, categoria e imagem.
     """
     ean_limpo = "".join(c for c in str(ean) if c.isdigit())
-    item = CatalogoMestre.query.filter_by(ean=ean_limpo, status="encontrado").first()
-    if not item:
+    entrada = catalogo_mestre.buscar_ean(ean_limpo)
+    if not entrada or entrada["status"] != "encontrado":
         return jsonify({"success": False, "message": "EAN não encontrado no catálogo mestre"}), 404
-    return jsonify({"success": True, "data": item.to_dict()}), 200
+    return jsonify({"success": True, "data": entrada}), 200
 
 
 @produtos_bp.route("/catalogo", methods=["GET"])
@@ -630,18 +855,27 @@ def catalogo_importar():
             cat_cache[nome] = c
         return cat_cache[nome]
 
+    # Existência checada em lote: um SELECT ... IN no catálogo e um nos produtos da loja
+    eans_limpos = ["".join(c for c in str(ean) if c.isdigit()) for ean in eans]
+    itens_catalogo, na_loja = {}, set()
+    for lote in catalogo_mestre._lotes(list(dict.fromkeys(eans_limpos))):
+        itens_catalogo.update((i.ean, i) for i in db.session.execute(
+            db.select(CatalogoMestre).where(CatalogoMestre.ean.in_(lote), CatalogoMestre.status == "encontrado")
+        ).scalars())
+        na_loja.update(db.session.execute(
+            db.select(Produto.codigo_barras).where(
+                Produto.estabelecimento_id == estabelecimento_id, Produto.codigo_barras.in_(lote),
+                Produto.deleted_at.is_(None))
+        ).scalars())
+
     importados, pulados = 0, 0
-    for ean in eans:
-        ean_limpo = "".join(c for c in str(ean) if c.isdigit())
-        item = CatalogoMestre.query.filter_by(ean=ean_limpo, status="encontrado").first()
-        if not item:
-            pulados += 1
-            continue
-        # Não duplicar produto já existente na loja
-        existe = Produto.query.filter_by(estabelecimento_id=estabelecimento_id, codigo_barras=ean_limpo).first()
-        if existe:
+    for ean_limpo in eans_limpos:
+        item = itens_catalogo.get(ean_limpo)
+        # Não duplicar produto já existente na loja (nem repetido na lista)
+        if not item or ean_limpo in na_loja:
             pulados += 1
             continue
+        na_loja.add(ean_limpo)
 
         preco_ref = item.preco_referencia or Decimal("0")
         if preco_ref and preco_ref > 0:
@@ -788,22 +1022,8 @@ def listar_produtos():
         # Parâmetros de paginação
         pagina = request.args.get("pagina", 1, type=int)
         por_pagina = request.args.get("por_pagina", 50, type=int)
-        
-        # Parâmetros de filtro
-        # O frontend envia "ativos" (productsService); aceita também "ativo"
-        # (legado). Antes só "ativo" era lido e o filtro era ignorado em
-        # silêncio — a lista mostrava inativos enquanto os cards contavam
-        # só ativos.
-        ativo = request.args.get("ativos", request.args.get("ativo"))
-        categoria = request.args.get("categoria")
-        fornecedor_id = request.args.get("fornecedor_id", type=int)
-        estoque_status = request.args.get("estoque_status") # baixo, esgotado, normal
-        tipo = request.args.get("tipo")
-        preco_min = request.args.get("preco_min", type=float)
-        preco_max = request.args.get("preco_max", type=float)
-        busca = request.args.get("busca", "", type=str).strip()
-        
-        # Parâmetros de ordenação
+
+        # Parâmetros de ordenação (os de filtro são lidos em aplicar_filtros_produtos)
         ordenar_por = request.args.get("ordenar_por", "nome")
         direcao = request.args.get("direcao", "asc")
         filtro_rapido = request.args.get("filtro_rapido", None, type=str)
@@ -826,224 +1046,18 @@ def listar_produtos():
             or request.args.get("expandir_por_lote", "").lower() == "true"
         )
 
-        query = db.session.query(Produto)
-        
-        # Filtro de Tenant OBRIGATÓRIO (Zero Leak)
-        if str(estabelecimento_id).lower() != 'all':
-            query = query.filter(Produto.estabelecimento_id == estabelecimento_id)
+        query = aplicar_filtros_produtos(db.session.query(Produto), request.args, estabelecimento_id)
+        query = ordenar_produtos(query, ordenar_por, direcao)
 
-        # Filtros de validade lidos aqui (antes dos aliases) para o alias
-        # "validade" funcionar — antes ele setava uma variável local que era
-        # sobrescrita pela releitura do request mais abaixo.
+        # Filtros de validade também decidem quais lotes a página exibe (o SQL
+        # deles está em aplicar_filtros_produtos; o alias "validade" vale aqui também).
         validade_proxima = request.args.get("validade_proxima")
         dias_validade = request.args.get("dias_validade", 30, type=int)
         vencidos = request.args.get("vencidos")
-
-        # Alias de filtros de alerta
-        if filtro_alerta == "baixo_estoque":
-            estoque_status = "baixo"
-        elif filtro_alerta == "validade":
+        if filtro_alerta == "validade":
             validade_proxima = "true"
-
-        # 1. Filtro de Ativo/Inativo
-        if ativo is not None:
-            is_ativo = ativo.lower() == "true"
-            query = query.filter(Produto.ativo == is_ativo)
-
-        # 2. Filtro de Categoria
-        if categoria:
-            query = query.join(CategoriaProduto).filter(CategoriaProduto.nome == categoria)
-
-        # 3. Filtro de Fornecedor
-        if fornecedor_id:
-            query = query.filter(Produto.fornecedor_id == fornecedor_id)
-
-        # 4. Filtro de Tipo (se existir no modelo, assumindo que sim ou usando categoria como proxy se necessário)
-        if tipo:
-            # Se houver campo 'tipo' ou usar categoria/subcategoria
-             query = query.filter(Produto.tipo == tipo)
-
-        # 5. Filtro de Preço
-        if preco_min is not None:
-            query = query.filter(Produto.preco_venda >= preco_min)
-        if preco_max is not None:
-            query = query.filter(Produto.preco_venda <= preco_max)
-
-        # 6. Filtro de Status de Estoque
-        if estoque_status:
-            if estoque_status == "esgotado":
-                query = query.filter(Produto.quantidade <= 0)
-            elif estoque_status == "baixo":
-                query = query.filter(Produto.quantidade <= Produto.quantidade_minima)
-            elif estoque_status == "normal":
-                query = query.filter(Produto.quantidade > Produto.quantidade_minima)
-
-        # 7. Busca Textual
-        if busca:
-            busca_termo = f"%{busca}%"
-            query = query.filter(
-                or_(
-                    ilike_unaccent(Produto.nome, busca_termo),
-                    ilike_unaccent(Produto.codigo_barras, busca_termo),
-                    ilike_unaccent(Produto.codigo_interno, busca_termo),
-                    ilike_unaccent(Produto.descricao, busca_termo),
-                    ilike_unaccent(Produto.marca, busca_termo),
-                )
-            )
-
-        # 8. Filtros de Validade (produto OU lotes do produto; fallback só por produto se lotes falhar)
         hoje = date.today()
 
-        try:
-            if validade_proxima and validade_proxima.lower() == "true":
-                limite = hoje + timedelta(days=dias_validade)
-                cond_produto = and_(
-                    Produto.data_validade.isnot(None),
-                    Produto.data_validade >= hoje,
-                    Produto.data_validade <= limite,
-                )
-                subq_lotes = db.session.query(ProdutoLote.produto_id).filter(
-                    ProdutoLote.ativo == True,
-                    ProdutoLote.quantidade > 0,
-                    ProdutoLote.data_validade >= hoje,
-                    ProdutoLote.data_validade <= limite,
-                )
-                if str(estabelecimento_id).lower() != 'all':
-                    subq_lotes = subq_lotes.filter(ProdutoLote.estabelecimento_id == estabelecimento_id)
-                
-                subq_lotes = subq_lotes.distinct()
-                query = query.filter(or_(cond_produto, Produto.id.in_(subq_lotes)))
-            if vencidos and vencidos.lower() == "true":
-                cond_produto = and_(
-                    Produto.quantidade > 0,
-                    Produto.data_validade.isnot(None),
-                    Produto.data_validade < hoje,
-                )
-                subq_lotes = (
-                    db.session.query(ProdutoLote.produto_id)
-                    .filter(
-                        ProdutoLote.estabelecimento_id == estabelecimento_id,
-                        ProdutoLote.ativo == True,
-                        ProdutoLote.quantidade > 0,
-                        ProdutoLote.data_validade < hoje,
-                    )
-                    .distinct()
-                )
-                query = query.filter(or_(cond_produto, Produto.id.in_(subq_lotes)))
-        except Exception:
-            # Fallback: filtrar só por data_validade do produto (sem lotes)
-            if validade_proxima and validade_proxima.lower() == "true":
-                dias = request.args.get("dias_validade", 30, type=int)
-                limite = hoje + timedelta(days=dias)
-                query = query.filter(Produto.quantidade > 0)
-                query = query.filter(Produto.data_validade.isnot(None))
-                query = query.filter(Produto.data_validade >= hoje, Produto.data_validade <= limite)
-            if vencidos and vencidos.lower() == "true":
-                query = query.filter(Produto.quantidade > 0)
-                query = query.filter(Produto.data_validade.isnot(None))
-                query = query.filter(Produto.data_validade < hoje)
-
-        # Filtro rápido por margem (Alta Margem >50%, Baixa Margem <30%)
-        if filtro_rapido == "margem_alta":
-            query = query.filter(Produto.margem_lucro >= 50)
-        elif filtro_rapido == "margem_baixa":
-            query = query.filter(Produto.margem_lucro < 30)
-        elif filtro_rapido in ("classe_a", "classe_b", "classe_c"):
-            # Classificação ABC DINÂMICA (por faturamento real), consistente com os
-            # contadores do dashboard. Evita depender da coluna gravada (que pode estar
-            # desatualizada/NULL e fazia o filtro voltar vazio).
-            if str(estabelecimento_id).lower() != "all":
-                # Janela móvel de 90 dias, cacheada por tenant — MESMA fonte que os
-                # cards/estatísticas usam. Antes recalculava ~10 anos de vendas a
-                # cada request (principal causa de lentidão do filtro).
-                from app.utils.abc_cache import get_classificacoes_abc
-                classificacoes = get_classificacoes_abc(estabelecimento_id)
-                ids_com_venda = list(classificacoes.keys())
-                if filtro_rapido == "classe_a":
-                    ids_a = [pid for pid, c in classificacoes.items() if c == "A"]
-                    query = query.filter(Produto.id.in_(ids_a if ids_a else [-1]))
-                elif filtro_rapido == "classe_b":
-                    ids_b = [pid for pid, c in classificacoes.items() if c == "B"]
-                    query = query.filter(Produto.id.in_(ids_b if ids_b else [-1]))
-                else:
-                    # Encalhados = classe C por faturamento + produtos sem nenhuma venda no período.
-                    ids_c = [pid for pid, c in classificacoes.items() if c == "C"]
-                    if ids_com_venda:
-                        query = query.filter(or_(Produto.id.in_(ids_c if ids_c else [-1]),
-                                                 ~Produto.id.in_(ids_com_venda)))
-                    # Sem nenhuma venda no tenant: todos são encalhados → não aplica filtro extra.
-            else:
-                alvo = "A" if filtro_rapido == "classe_a" else ("B" if filtro_rapido == "classe_b" else "C")
-                query = query.filter(func.upper(Produto.classificacao_abc) == alvo)
-        elif filtro_rapido == "repor_urgente":
-            query = query.filter(
-                or_(
-                    Produto.quantidade == 0,
-                    Produto.quantidade <= Produto.quantidade_minima
-                )
-            )
-        # NOTA: giro_rapido/normal/lento NÃO são filtrados aqui em SQL.
-        # São resolvidos em Python via classificar_giro_produto() (cobertura/VMD),
-        # a MESMA função usada pelos contadores do dashboard — garantindo que o
-        # número do card e a quantidade exibida na lista/modal sejam idênticos.
-
-        # Filtro por Classificação ABC (drill-down do dashboard)
-        classificacao_abc = request.args.get("classificacao_abc")
-        if classificacao_abc:
-            query = query.filter(func.upper(Produto.classificacao_abc) == classificacao_abc.upper())
-
-        # Filtro por Giro de Estoque (drill-down do dashboard)
-        # rapido/estrela: alto volume vendido | lento: vende pouco | parado: não vende
-        giro = request.args.get("giro")
-        if giro:
-            g = giro.lower()
-            if g in ("rapido", "estrela", "alto"):
-                query = query.filter(Produto.quantidade_vendida >= 30)
-            elif g in ("lento", "baixo"):
-                query = query.filter(
-                    Produto.quantidade_vendida > 0,
-                    Produto.quantidade_vendida < 30,
-                )
-            elif g in ("parado", "encalhado"):
-                query = query.filter(
-                    or_(Produto.quantidade_vendida == 0, Produto.quantidade_vendida.is_(None)),
-                    Produto.quantidade > 0,
-                )
-
-        # 8. Ordenação
-        # 4. Ordenação Robusta
-        # Whitelist de colunas permitidas para evitar UndefinedColumn no Postgres
-        COLUNAS_ORDENACAO_VALIDAS = {
-            "nome": Produto.nome,
-            "preco_venda": Produto.preco_venda,
-            "preco_custo": Produto.preco_custo,
-            "precocusto": Produto.preco_custo, # Handle typo
-            "quantidade": Produto.quantidade,
-            "categoria": Produto.categoria_id,
-            "atualizado": Produto.updated_at,
-            "margem_lucro": Produto.margem_lucro,
-            "valor_total_estoque": func.coalesce(Produto.preco_custo * Produto.quantidade, 0),
-            # Ordenações usadas pelos filtros rápidos e pelo modal de filtros
-            # avançados — estavam fora da whitelist e caíam em silêncio para
-            # "nome" (o usuário pedia "mais vendidos" e recebia ordem alfabética).
-            "total_vendido": Produto.total_vendido,
-            "quantidade_vendida": Produto.quantidade_vendida,
-            "ultima_venda": Produto.ultima_venda,
-            "data_validade": Produto.data_validade,
-        }
-
-        # Colunas nullable: produto nunca vendido / sem validade sempre por
-        # último, em qualquer direção — senão o "top vendidos desc" começava
-        # com uma página de NULLs no Postgres.
-        _COLUNAS_NULLABLE = {"total_vendido", "quantidade_vendida", "ultima_venda", "data_validade", "margem_lucro"}
-
-        coluna_ordenacao = COLUNAS_ORDENACAO_VALIDAS.get(ordenar_por, Produto.nome)
-
-        ordem = coluna_ordenacao.desc() if direcao == "desc" else coluna_ordenacao.asc()
-        if ordenar_por in _COLUNAS_NULLABLE:
-            ordem = ordem.nullslast()
-        query = query.order_by(ordem, Produto.id.asc())
-
         import math
         _giro_buckets = ("giro_rapido", "giro_normal", "giro_lento")
 
@@ -3721,158 +3735,31 @@ def alertas_produtos():
     - lote_vencendo_medio: Lote vencendo em 8-30 dias (ATENÇÃO)
     - estoque_baixo: Produto com estoque abaixo do mínimo
     - sem_movimento: Produto sem vendas há mais de 180 dias
+
+    Os alertas vêm de alertas_estoque (EstoqueAlertasService), mantida pelo
+    job agendado; a janela de validade é Configuracao.dias_alerta_validade.
     
     Query params:
     - tipo: Filtrar por tipo de alerta (ex: ?tipo=lote_vencido)
-    - dias: Dias para considerar validade próxima (default: 30)
+    - dias: Restringe a validade próxima a N dias (default: configuração da loja)
     """
     try:
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
+        from app.services.estoque_alertas_service import EstoqueAlertasService
         estabelecimento_id = get_authorized_establishment_id()
         
         # Parâmetros opcionais
         filtro_tipo = request.args.get("tipo")
-        dias_alerta = int(request.args.get("dias", 30))
-        
-        alertas = []
-        hoje = date.today()
-
-        # ═══════════════════════════════════════════════════════════
-        # 🔴 LOTES JÁ VENCIDOS (AÇÃO IMEDIATA - retirar da gôndola)
-        # ═══════════════════════════════════════════════════════════
-        if not filtro_tipo or filtro_tipo == "lote_vencido":
-            lotes_vencidos = ProdutoLote.query.filter(
-                ProdutoLote.estabelecimento_id == estabelecimento_id,
-                ProdutoLote.ativo == True,
-                ProdutoLote.quantidade > 0,
-                ProdutoLote.data_validade < hoje,
-            ).order_by(ProdutoLote.data_validade.asc()).all()
-
-            for lote in lotes_vencidos:
-                dias_vencido = (hoje - lote.data_validade).days
-                alertas.append({
-                    "tipo": "lote_vencido",
-                    "nivel": "critico",
-                    "produto_id": lote.produto_id,
-                    "produto_nome": lote.produto.nome if lote.produto else None,
-                    "lote_id": lote.id,
-                    "numero_lote": lote.numero_lote,
-                    "quantidade_no_lote": lote.quantidade,
-                    "data_validade": lote.data_validade.isoformat(),
-                    "dias_vencido": dias_vencido,
-                    "mensagem": f"VENCIDO há {dias_vencido} dia(s)! Lote {lote.numero_lote} com {lote.quantidade} un. Retirar imediatamente.",
-                    "acao_sugerida": "Retirar da gôndola e registrar perda/descarte",
-                })
-
-        # ═══════════════════════════════════════════════════════════
-        # 🟠 LOTES VENCENDO EM 1-7 DIAS (CRÍTICO - promover venda)
-        # ═══════════════════════════════════════════════════════════
-        if not filtro_tipo or filtro_tipo == "lote_vencendo_critico":
-            lotes_criticos = ProdutoLote.query.filter(
-                ProdutoLote.estabelecimento_id == estabelecimento_id,
-                ProdutoLote.ativo == True,
-                ProdutoLote.quantidade > 0,
-                ProdutoLote.data_validade.between(hoje, hoje + timedelta(days=7)),
-            ).order_by(ProdutoLote.data_validade.asc()).all()
-
-            for lote in lotes_criticos:
-                dias_restantes = (lote.data_validade - hoje).days
-                alertas.append({
-                    "tipo": "lote_vencendo_critico",
-                    "nivel": "critico",
-                    "produto_id": lote.produto_id,
-                    "produto_nome": lote.produto.nome if lote.produto else None,
-                    "lote_id": lote.id,
-                    "numero_lote": lote.numero_lote,
-                    "quantidade_no_lote": lote.quantidade,
-                    "data_validade": lote.data_validade.isoformat(),
-                    "dias_restantes": dias_restantes,
-                    "mensagem": f"Vence em {dias_restantes} dia(s)! Lote {lote.numero_lote} com {lote.quantidade} un.",
-                    "acao_sugerida": "Colocar em promoção ou posicionar na frente da gôndola (FIFO)",
-                })
-
-        # ═══════════════════════════════════════════════════════════
-        # 🟡 LOTES VENCENDO EM 8-30 DIAS (ATENÇÃO - monitorar)
-        # ═══════════════════════════════════════════════════════════
-        if not filtro_tipo or filtro_tipo == "lote_vencendo_medio":
-            lotes_medios = ProdutoLote.query.filter(
-                ProdutoLote.estabelecimento_id == estabelecimento_id,
-                ProdutoLote.ativo == True,
-                ProdutoLote.quantidade > 0,
-                ProdutoLote.data_validade.between(
-                    hoje + timedelta(days=8), 
-                    hoje + timedelta(days=dias_alerta)
-                ),
-            ).order_by(ProdutoLote.data_validade.asc()).all()
+        dias_param = request.args.get("dias")
+        dias_alerta = int(dias_param) if dias_param else None
 
-            for lote in lotes_medios:
-                dias_restantes = (lote.data_validade - hoje).days
-                alertas.append({
-                    "tipo": "lote_vencendo_medio",
-                    "nivel": "medio",
-                    "produto_id": lote.produto_id,
-                    "produto_nome": lote.produto.nome if lote.produto else None,
-                    "lote_id": lote.id,
-                    "numero_lote": lote.numero_lote,
-                    "quantidade_no_lote": lote.quantidade,
-                    "data_validade": lote.data_validade.isoformat(),
-                    "dias_restantes": dias_restantes,
-                    "mensagem": f"Vence em {dias_restantes} dia(s). Lote {lote.numero_lote} com {lote.quantidade} un.",
-                    "acao_sugerida": "Monitorar e priorizar venda via FIFO",
-                })
-
-        # ═══════════════════════════════════════════════════════════
-        # 📦 ESTOQUE BAIXO
-        # ═══════════════════════════════════════════════════════════
-        if not filtro_tipo or filtro_tipo == "estoque_baixo":
-            produtos_estoque_baixo = Produto.query.filter(
-                Produto.estabelecimento_id == estabelecimento_id,
-                Produto.ativo == True,
-                Produto.quantidade_minima > 0,
-                Produto.quantidade <= Produto.quantidade_minima,
-            ).all()
-
-            for produto in produtos_estoque_baixo:
-                alertas.append({
-                    "tipo": "estoque_baixo",
-                    "nivel": "alto" if produto.quantidade == 0 else "medio",
-                    "produto_id": produto.id,
-                    "produto_nome": produto.nome,
-                    "mensagem": f"Estoque baixo: {produto.quantidade} un. (mín: {produto.quantidade_minima})",
-                    "quantidade": produto.quantidade,
-                    "quantidade_minima": produto.quantidade_minima,
-                    "acao_sugerida": "Criar pedido de compra para reposição",
-                })
-
-        # ═══════════════════════════════════════════════════════════
-        # 💤 SEM MOVIMENTAÇÃO
-        # ═══════════════════════════════════════════════════════════
-        if not filtro_tipo or filtro_tipo == "sem_movimento":
-            data_limite = datetime.now(timezone.utc) - timedelta(days=180)
-            produtos_sem_movimento = Produto.query.filter(
-                Produto.estabelecimento_id == estabelecimento_id,
-                Produto.ativo == True,
-                Produto.quantidade > 0,
-                db.or_(Produto.ultima_venda == None, Produto.ultima_venda < data_limite),
-            ).all()
-
-            for produto in produtos_sem_movimento:
-                if produto.ultima_venda:
-                    dias_sem_venda = (datetime.now(timezone.utc) - produto.ultima_venda).days
-                    alertas.append({
-                        "tipo": "sem_movimento",
-                        "nivel": "baixo",
-                        "produto_id": produto.id,
-                        "produto_nome": produto.nome,
-                        "mensagem": f"Sem vendas há {dias_sem_venda} dias",
-                        "dias_sem_venda": dias_sem_venda,
-                        "ultima_venda": produto.ultima_venda.isoformat() if produto.ultima_venda else None,
-                        "acao_sugerida": "Avaliar promoção ou remoção do mix de produtos",
-                    })
-
-        # Ordenar por nível de criticidade
-        nivel_prioridade = {"critico": 1, "alto": 2, "medio": 3, "baixo": 4}
-        alertas.sort(key=lambda x: nivel_prioridade.get(x["nivel"], 5))
+        # Lê o estado persistido em alertas_estoque (novo/ativo); a detecção
+        # roda só no job agendado, nunca dentro do GET.
+        alertas = EstoqueAlertasService.listar(
+            estabelecimento_id, tipo=filtro_tipo, dias_alerta=dias_alerta
+        )
+        if dias_alerta is None:
+            dias_alerta = EstoqueAlertasService.dias_alerta(estabelecimento_id)
 
         # Resumo por tipo
         resumo = {
@@ -3907,128 +3794,117 @@ def alertas_produtos():
         )
 
 
+def _consulta_exportacao_produtos(estabelecimento_id, args):
+    """Select só de colunas do produto + nomes de categoria/fornecedor (aliases,
+    para não colidir com o join do filtro por categoria), com os filtros e a
+    ordenação da listagem."""
+    categoria, fornecedor = aliased(CategoriaProduto), aliased(Fornecedor)
+    consulta = (
+        db.select(
+            Produto.id, Produto.codigo_barras, Produto.codigo_interno, Produto.nome, Produto.descricao,
+            Produto.marca, Produto.subcategoria, Produto.unidade_medida, Produto.quantidade,
+            Produto.quantidade_minima, Produto.preco_custo, Produto.preco_venda, Produto.ncm, Produto.origem,
+            Produto.controlar_validade, Produto.data_validade, Produto.lote, Produto.total_vendido,
+            Produto.quantidade_vendida, Produto.ultima_venda, Produto.classificacao_abc, Produto.ativo,
+            Produto.created_at, categoria.nome.label("categoria_nome"),
+            fornecedor.nome_fantasia.label("fornecedor_nome"), fornecedor.razao_social.label("fornecedor_razao"),
+        )
+        .select_from(Produto)
+        .outerjoin(categoria, categoria.id == Produto.categoria_id)
+        .outerjoin(fornecedor, fornecedor.id == Produto.fornecedor_id)
+        .where(Produto.deleted_at.is_(None))
+    )
+    consulta = aplicar_filtros_produtos(consulta, args, estabelecimento_id)
+    return ordenar_produtos(consulta, args.get("ordenar_por", "nome"), args.get("direcao", "asc"))
+
+
+def _data(valor, formato):
+    return valor.strftime(formato) if valor else ""
+
+
+def _margem(p):
+    return calcular_margem_lucro(float(p.preco_venda or 0), float(p.preco_custo or 0))
+
+
+@registrar_exportacao("produtos")
+def exportacao_produtos(estabelecimento_id, args):
+    """Layout completo de GET /api/produtos/exportar."""
+    return Exportacao("produtos", _consulta_exportacao_produtos(estabelecimento_id, args), [
+        Coluna("ID", "id"),
+        Coluna("Código Barras", "codigo_barras"),
+        Coluna("Código Interno", "codigo_interno"),
+        Coluna("Nome", "nome"),
+        Coluna("Descrição", "descricao"),
+        Coluna("Marca", "marca"),
+        Coluna("Categoria", "categoria_nome"),
+        Coluna("Subcategoria", "subcategoria"),
+        Coluna("Unidade Medida", "unidade_medida"),
+        Coluna("Quantidade", "quantidade"),
+        Coluna("Quantidade Mínima", "quantidade_minima"),
+        Coluna("Preço Custo", lambda p: float(p.preco_custo or 0)),
+        Coluna("Preço Venda", lambda p: float(p.preco_venda or 0)),
+        Coluna("Margem Lucro %", _margem),
+        Coluna("NCM", "ncm"),
+        Coluna("Origem", "origem"),
+        Coluna("Controlar Validade", lambda p: "SIM" if p.controlar_validade else "NÃO"),
+        Coluna("Data Validade", lambda p: _data(p.data_validade, "%d/%m/%Y")),
+        Coluna("Lote", "lote"),
+        Coluna("Fornecedor", "fornecedor_nome"),
+        Coluna("Total Vendido", lambda p: p.total_vendido or 0),
+        Coluna("Quantidade Vendida", lambda p: p.quantidade_vendida or 0),
+        Coluna("Última Venda", lambda p: _data(p.ultima_venda, "%d/%m/%Y %H:%M")),
+        Coluna("Classificação ABC", calcular_classificacao_abc),
+        Coluna("Ativo", lambda p: "SIM" if p.ativo else "NÃO"),
+        Coluna("Data Cadastro", lambda p: _data(p.created_at, "%d/%m/%Y %H:%M:%S")),
+    ])
+
+
+@registrar_exportacao("produtos_resumo")
+def exportacao_produtos_resumo(estabelecimento_id, args):
+    """Layout enxuto de GET /api/produtos/exportar/csv."""
+    return Exportacao("produtos", _consulta_exportacao_produtos(estabelecimento_id, args), [
+        Coluna("ID", "id"),
+        Coluna("Nome", "nome"),
+        Coluna("Código Barras", "codigo_barras"),
+        Coluna("Código Interno", "codigo_interno"),
+        Coluna("Categoria", lambda p: p.categoria_nome or "Sem categoria"),
+        Coluna("Marca", "marca"),
+        Coluna("Unidade", lambda p: p.unidade_medida or "UN"),
+        Coluna("Quantidade", "quantidade"),
+        Coluna("Quantidade Mínima", "quantidade_minima"),
+        Coluna("Preço Custo", lambda p: float(p.preco_custo or 0)),
+        Coluna("Preço Venda", lambda p: float(p.preco_venda or 0)),
+        Coluna("Margem Lucro %", _margem),
+        Coluna("Fornecedor", lambda p: p.fornecedor_razao or p.fornecedor_nome or ""),
+        Coluna("Ativo", lambda p: "Sim" if p.ativo else "Não"),
+        Coluna("Data Cadastro", lambda p: _data(p.created_at, "%d/%m/%Y %H:%M")),
+    ], delimitador=",")
+
+
 @produtos_bp.route("/exportar", methods=["GET"])
 @funcionario_required
 def exportar_produtos():
-    """Exporta produtos em formato CSV"""
+    """Exporta produtos em CSV (stream) ou Excel, com os filtros da listagem.
+
+    ?formato=csv|excel, ?assincrono=true gera o arquivo em background. Sem
+    ativo/ativos na query string exporta só os ativos, como sempre fez."""
     try:
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
-        
-        apenas_ativos = request.args.get("ativo", "true", type=str).lower() == "true"
-
-        # Buscar produtos
-        query = Produto.query.filter_by(
-            estabelecimento_id=estabelecimento_id
-        )
-
-        if apenas_ativos:
-            query = query.filter_by(ativo=True)
-
-        produtos = query.order_by(Produto.nome.asc()).all()
-
-        # Gerar CSV
-        import csv
-        import io
-
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter=";")
-
-        # Cabeçalho
-        writer.writerow(
-            [
-                "ID",
-                "Código Barras",
-                "Código Interno",
-                "Nome",
-                "Descrição",
-                "Marca",
-                "Categoria",
-                "Subcategoria",
-                "Unidade Medida",
-                "Quantidade",
-                "Quantidade Mínima",
-                "Preço Custo",
-                "Preço Venda",
-                "Margem Lucro %",
-                "NCM",
-                "Origem",
-                "Controlar Validade",
-                "Data Validade",
-                "Lote",
-                "Fornecedor",
-                "Total Vendido",
-                "Quantidade Vendida",
-                "Última Venda",
-                "Classificação ABC",
-                "Ativo",
-                "Data Cadastro",
-            ]
-        )
-
-        # Dados
-        for produto in produtos:
-            fornecedor_nome = (
-                produto.fornecedor.nome_fantasia if produto.fornecedor else ""
-            )
-            classificacao = calcular_classificacao_abc(produto)
-            margem = calcular_margem_lucro(
-                float(produto.preco_venda), float(produto.preco_custo)
-            )
-
-            writer.writerow(
-                [
-                    produto.id,
-                    produto.codigo_barras or "",
-                    produto.codigo_interno or "",
-                    produto.nome or "",
-                    produto.descricao or "",
-                    produto.marca or "",
-                    produto.categoria or "",
-                    produto.subcategoria or "",
-                    produto.unidade_medida or "",
-                    produto.quantidade,
-                    produto.quantidade_minima,
-                    float(produto.preco_custo),
-                    float(produto.preco_venda),
-                    margem,
-                    produto.ncm or "",
-                    produto.origem,
-                    "SIM" if produto.controlar_validade else "NÃO",
-                    (
-                        produto.data_validade.strftime("%d/%m/%Y")
-                        if produto.data_validade
-                        else ""
-                    ),
-                    produto.lote or "",
-                    fornecedor_nome,
-                    produto.total_vendido or 0,
-                    produto.quantidade_vendida or 0,
-                    (
-                        produto.ultima_venda.strftime("%d/%m/%Y %H:%M")
-                        if produto.ultima_venda
-                        else ""
-                    ),
-                    classificacao,
-                    "SIM" if produto.ativo else "NÃO",
-                    (
-                        produto.created_at.strftime("%d/%m/%Y %H:%M:%S")
-                        if produto.created_at
-                        else ""
-                    ),
-                ]
-            )
+        if not estabelecimento_id:
+            return jsonify({"success": False, "message": "Estabelecimento não identificado"}), 400
 
-        output.seek(0)
-        return (
-            output.getvalue(),
-            200,
-            {
-                "Content-Type": "text/csv; charset=utf-8",
-                "Content-Disposition": f'attachment; filename=produtos_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
-            },
-        )
+        args = request.args.copy()
+        if "ativo" not in args and "ativos" not in args:
+            args["ativo"] = "true"
+        formato = args.get("formato", "csv", type=str).lower()
+        formato = "xlsx" if formato == "excel" else formato
+        return responder("produtos", estabelecimento_id, args, formato,
+                         f'produtos_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{formato}',
+                         funcionario_id=get_jwt_identity())
 
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Erro ao exportar produtos: {str(e)}")
         return (
@@ -4077,69 +3953,20 @@ def registrar_venda_produto(produto_id, quantidade, preco_venda, venda_id):
 @produtos_bp.route("/exportar/csv", methods=["GET"])
 @funcionario_required
 def exportar_csv():
-    """Exporta produtos para CSV"""
+    """Exporta produtos para CSV (conteúdo no JSON, para o download do frontend)"""
     try:
-        import csv
-        from io import StringIO
-        
-        # Obter claims do JWT
-        from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id
+        from app.utils.query_helpers import get_authorized_establishment_id
         estabelecimento_id = get_authorized_establishment_id()
-        
-        ativos = request.args.get("ativos", None, type=str)
-        
-        # Query base
-        query = Produto.query.filter_by(estabelecimento_id=estabelecimento_id)
-        
-        if ativos is not None:
-            query = query.filter_by(ativo=ativos.lower() == "true")
-        
-        produtos = query.order_by(Produto.nome.asc()).all()
-        
-        # Criar CSV em memória
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Cabeçalho
-        writer.writerow([
-            'ID', 'Nome', 'Código Barras', 'Código Interno', 'Categoria',
-            'Marca', 'Unidade', 'Quantidade', 'Quantidade Mínima',
-            'Preço Custo', 'Preço Venda', 'Margem Lucro %',
-            'Fornecedor', 'Ativo', 'Data Cadastro'
-        ])
-        
-        # Dados
-        for produto in produtos:
-            categoria_nome = produto.categoria.nome if produto.categoria else "Sem categoria"
-            fornecedor_nome = ""
-            if produto.fornecedor:
-                fornecedor_nome = produto.fornecedor.razao_social or produto.fornecedor.nome_fantasia
-            
-            writer.writerow([
-                produto.id,
-                produto.nome,
-                produto.codigo_barras or "",
-                produto.codigo_interno or "",
-                categoria_nome,
-                produto.marca or "",
-                produto.unidade_medida or "UN",
-                produto.quantidade,
-                produto.quantidade_minima,
-                float(produto.preco_custo),
-                float(produto.preco_venda),
-                calcular_margem_lucro(float(produto.preco_venda), float(produto.preco_custo)),
-                fornecedor_nome,
-                "Sim" if produto.ativo else "Não",
-                produto.created_at.strftime("%d/%m/%Y %H:%M") if produto.created_at else ""
-            ])
-        
-        csv_content = output.getvalue()
-        output.close()
-        
+
+        # Linhas lidas do banco em blocos e só com as colunas do arquivo;
+        # para catálogos enormes use /exportar (stream) ou ?assincrono=true lá.
+        exportacao = construir("produtos_resumo", estabelecimento_id, request.args)
+        csv_content = "".join(gerar_csv(exportacao))
+
         return jsonify({
             "success": True,
             "csv": csv_content,
-            "total_produtos": len(produtos)
+            "total_produtos": exportacao.total
         })
         
     except Exception as e:
@@ -4980,17 +4807,15 @@ def atualizar_classificacao_abc():
 @funcionario_required
 def importar_produtos_csv():
     """
-    Importa produtos em massa via CSV.
+    Importa produtos em massa via CSV (job em background; ver importacao_service).
     Permissao: ADMIN ou GERENTE.
+    Form/query: arquivo (CSV), simular=true (só valida e conta), atualizar=true
+    (produtos já cadastrados têm cadastro e preços atualizados em vez de rejeitados).
     """
-    import csv
-    import io
-    from decimal import Decimal
-    
     try:
         # 1. Validar Permissoes
         claims = get_jwt()
-        role = claims.get("role")
+        role = str(claims.get("role") or "").upper()
         if role not in ["ADMIN", "GERENTE"]:
             return (
                 jsonify({
@@ -4999,164 +4824,50 @@ def importar_produtos_csv():
                 }),
                 403,
             )
-        
+
         estabelecimento_id = claims.get("estabelecimento_id")
         funcionario_id = claims.get("sub") # ID do funcionario logado
-        
+
         # 2. Validar Arquivo
         if 'arquivo' not in request.files:
             return jsonify({"success": False, "message": "Nenhum arquivo enviado"}), 400
-        
+
         file = request.files['arquivo']
         if file.filename == '':
             return jsonify({"success": False, "message": "Arquivo invalido"}), 400
-        
-        if not file.filename.endswith('.csv'):
-            return jsonify({"success": False, "message": "O arquivo deve ser um CSV"}), 400
 
-        # 3. Processar CSV
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-        reader = csv.DictReader(stream, delimiter=';') # Padrao comum em Excel PT-BR eh ';'
-        
-        # Se nao encontrar nada com ';', tentar ','
-        if not reader.fieldnames or len(reader.fieldnames) < 2:
-            stream.seek(0)
-            reader = csv.DictReader(stream, delimiter=',')
-            
-        success_count = 0
-        error_count = 0
-        errors = []
-        
-        # Cache de categorias para evitar queries repetitivas
-        categorias_cache = {}
-        
-        for row_idx, row in enumerate(reader, start=1):
-            try:
-                # Limpeza de dados
-                nome = row.get('nome', '').strip()
-                cat_nome = row.get('categoria', '').strip()
-                preco_custo_str = row.get('preco_custo', '0').replace(',', '.')
-                marca = row.get('marca', '').strip()
-                unidade = row.get('unidade', 'UN').strip()
-                qtd_inicial_str = row.get('estoque', '0').strip()
-                qtd_inicial = int(qtd_inicial_str) if qtd_inicial_str.isdigit() else 0
-                
-                lote_num = row.get('lote', '').strip()
-                validade_str = row.get('data_validade', '').strip()
-                data_validade = None
-                
-                if validade_str:
-                    try:
-                        # Tenta vários formatos comuns
-                        for fmt in ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y'):
-                            try:
-                                data_validade = datetime.strptime(validade_str, fmt).date()
-                                break
-                            except ValueError:
-                                continue
-                        if not data_validade:
-                            errors.append(f"Linha {row_idx}: Formato de data invalido para '{validade_str}'")
-                    except Exception:
-                        pass
-                
-                # Validações básicas
-                if not nome:
-                    errors.append(f"Linha {row_idx}: Nome do produto eh obrigatorio")
-                    error_count += 1
-                    continue
-                if not cat_nome:
-                    errors.append(f"Linha {row_idx}: Categoria eh obrigatoria")
-                    error_count += 1
-                    continue
-                
-                # Tratar Categoria
-                if cat_nome not in categorias_cache:
-                    cat = CategoriaProduto.query.filter_by(
-                        nome=cat_nome, 
-                        estabelecimento_id=estabelecimento_id
-                    ).first()
-                    
-                    if not cat:
-                        cat = CategoriaProduto(
-                            nome=cat_nome, 
-                            estabelecimento_id=estabelecimento_id,
-                            ativo=True
-                        )
-                        db.session.add(cat)
-                        db.session.flush() # Para pegar o ID
-                    
-                    categorias_cache[cat_nome] = cat.id
-                
-                categoria_id = categorias_cache[cat_nome]
-                
-                # Criar Produto
-                novo_produto = Produto(
-                    estabelecimento_id=estabelecimento_id,
-                    categoria_id=categoria_id,
-                    nome=nome,
-                    codigo_barras=codigo_barras or None,
-                    codigo_interno=codigo_interno or None,
-                    marca=marca,
-                    unidade_medida=unidade,
-                    preco_custo=Decimal(preco_custo_str),
-                    preco_venda=Decimal(preco_venda_str),
-                    quantidade=qtd_inicial,
-                    lote=lote_num or None,
-                    data_validade=data_validade,
-                    controlar_validade=True if data_validade else False,
-                    ativo=True
-                )
-                
-                db.session.add(novo_produto)
-                db.session.flush() # Para pegar o ID do produto para o lote
-                
-                # Auditoria SaaS
-                Auditoria.registrar(
-                    estabelecimento_id=estabelecimento_id,
-                    tipo_evento="produto_criado",
-                    descricao=f"Produto '{novo_produto.nome}' importado via Bulk",
-                    valor=novo_produto.preco_venda,
-                    detalhes={"id": novo_produto.id, "nome": novo_produto.nome, "metodo": "import_bulk"}
-                )
+        if not file.filename.lower().endswith('.csv'):
+            return jsonify({"success": False, "message": "O arquivo deve ser um CSV"}), 400
 
-                # Se informou estoque > 0, cria o primeiro lote oficial
-                if qtd_inicial > 0:
-                    novo_lote = ProdutoLote(
-                        estabelecimento_id=estabelecimento_id,
-                        produto_id=novo_produto.id,
-                        numero_lote=lote_num or f"IMPORT-{date.today().strftime('%Y%m%d')}",
-                        quantidade=qtd_inicial,
-                        quantidade_inicial=qtd_inicial,
-                        data_validade=data_validade or (date.today() + timedelta(days=365)), # Fallback 1 ano se nao informado
-                        data_entrada=date.today(),
-                        preco_custo_unitario=Decimal(preco_custo_str),
-                        preco_venda=Decimal(preco_venda_str),
-                        ativo=True
-                    )
-                    db.session.add(novo_lote)
+        # 3. Agendar: o arquivo vai para o spool e é processado em blocos
+        return responder_importacao("produtos", file, estabelecimento_id, request.values, funcionario_id)
 
-                success_count += 1
-                
-                # Commit parcial a cada 50 itens para performance e seguranca
-                if success_count % 50 == 0:
-                    db.session.commit()
-                    
-            except Exception as row_err:
-                db.session.rollback()
-                errors.append(f"Linha {row_idx}: Erro inesperado - {str(row_err)}")
-                error_count += 1
-                
-        db.session.commit()
-        
-        return jsonify({
-            "success": True,
-            "message": f"Importacao concluida: {success_count} produtos importados, {error_count} erros.",
-            "total_importados": success_count,
-            "total_erros": error_count,
-            "erros": errors[:10] # Retornar apenas os 10 primeiros erros
-        })
-        
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Erro na importacao de produtos: {str(e)}")
         return jsonify({"success": False, "message": f"Erro interno na importacao: {str(e)}"}), 500
+
+
+@produtos_bp.route("/importar/<handle>", methods=["GET"])
+@funcionario_required
+def status_importacao_produtos(handle):
+    """Progresso e erros por linha de uma importação de produtos."""
+    job = ImportacaoService.localizar(handle, "produtos", get_authorized_establishment_id())
+    if not job:
+        return jsonify({"success": False, "message": "Importação não encontrada"}), 404
+    return jsonify({"success": True, "importacao": job.to_dict()})
+
+
+@produtos_bp.route("/importar/<handle>/confirmar", methods=["POST"])
+@funcionario_required
+def confirmar_importacao_produtos(handle):
+    """Executa de verdade uma simulação concluída (mesmo arquivo, sem reenvio)."""
+    if str(get_jwt().get("role") or "").upper() not in ["ADMIN", "GERENTE"]:
+        return jsonify({"success": False, "message": "Permissao negada."}), 403
+    job = ImportacaoService.localizar(handle, "produtos", get_authorized_establishment_id())
+    if not job:
+        return jsonify({"success": False, "message": "Importação não encontrada"}), 404
+    try:
+        return resposta_importacao(ImportacaoService.confirmar(job))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 409
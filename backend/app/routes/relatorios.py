@@ -12,7 +12,7 @@ FEATURES IMPLEMENTADAS:
 - Queries otimizadas com SQLAlchemy para performance em PostgreSQL
 """
 
-from flask import Blueprint, request, jsonify, send_file, current_app
+from flask import Blueprint, request, jsonify, send_file, current_app, Response, stream_with_context
 from app import db
 from app.models import (
     Venda,
@@ -28,29 +28,23 @@ from app.models import (
 from datetime import datetime, timedelta, date
 from decimal import Decimal
 # NOTA: pandas é importado localmente apenas nas funções de exportação que o
-# usam (exportar_clientes_em_risco / exportar_backup_local). Import no nível do
+# usam (exportar_clientes_em_risco). Import no nível do
 # módulo carregava pandas+numpy (~120MB) no boot de CADA worker gunicorn e
 # contribuía para o estouro de memória no Render Starter (512MB).
 import io
 import json
-import zipfile
 from sqlalchemy import func, extract, and_, or_, cast, String, desc
 from app.decorators.decorator_jwt import funcionario_required, gerente_ou_admin_required
 from app.decorators.plan_guards import plan_required
 from app.utils.timezone import fmt_local, iso_local
 from collections import defaultdict
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any
 from app.utils.metrics_calculator import MetricsCalculator
 
 relatorios_bp = Blueprint("relatorios", __name__)
 
 # ==================== CONSTANTES ====================
 
-# Thresholds para análise RFM (em dias)
-RFM_RECENCY_THRESHOLDS = [30, 60, 90, 120]  # Quanto menor, melhor
-RFM_FREQUENCY_THRESHOLDS = [1, 3, 5, 7, 10]  # Quanto maior, melhor
-RFM_MONETARY_THRESHOLDS = [100, 250, 500, 1000]  # Quanto maior, melhor
-
 # Classificação ABC
 ABC_CLASS_A_THRESHOLD = 0.80  # 80% do faturamento
 ABC_CLASS_B_THRESHOLD = 0.95  # 95% do faturamento
@@ -62,145 +56,63 @@ STOCK_PREDICTION_DAYS = 7  # Média móvel dos últimos 7 dias
 
 # ==================== FUNÇÕES AUXILIARES - RFM ====================
 
-def calcular_score_rfm(recency_days: int, frequency: int, monetary: float) -> Tuple[int, int, int]:
-    """
-    Calcula scores RFM (1-5) baseado em thresholds.
-    
-    Returns:
-        Tuple[recency_score, frequency_score, monetary_score]
+def analise_rfm_clientes(estabelecimento_id: int, days: int = 180, data_inicio: datetime = None, data_fim: datetime = None) -> List[Dict[str, Any]]:
     """
-    # Recency: quanto menor, melhor (invertido)
-    r_score = 5
-    for threshold in RFM_RECENCY_THRESHOLDS:
-        if recency_days > threshold:
-            r_score -= 1
-    r_score = max(1, r_score)
-    
-    # Frequency: quanto maior, melhor
-    f_score = 1
-    for threshold in RFM_FREQUENCY_THRESHOLDS:
-        if frequency >= threshold:
-            f_score += 1
-    f_score = min(5, f_score)
-    
-    # Monetary: quanto maior, melhor
-    m_score = 1
-    for threshold in RFM_MONETARY_THRESHOLDS:
-        if monetary >= threshold:
-            m_score += 1
-    m_score = min(5, m_score)
-    
-    return (r_score, f_score, m_score)
+    Análise RFM completa de clientes.
 
-
-def segmentar_cliente_rfm(r_score: int, f_score: int, m_score: int) -> str:
-    """
-    Segmenta cliente baseado nos scores RFM.
-    
-    Segmentos:
-    - Campeões: R≥4, F≥4, M≥4
-    - Fiéis: R≥4, F≥3
-    - Em Risco: R≤2, (F≥3 ou M≥3)
-    - Perdidos: R=1, F≤2
-    - Regular: Demais
+    Janela do snapshot (últimos `days` dias): lê os scores persistidos em
+    clientes_rfm (recalculados pelo agendador). Outra janela ou período explícito:
+    calcula na hora com a mesma consulta agrupada do motor, sem persistir.
     """
-    if r_score >= 4 and f_score >= 4 and m_score >= 4:
-        return "Campeão"
-    elif r_score >= 4 and f_score >= 3:
-        return "Fiel"
-    elif r_score <= 2 and (f_score >= 3 or m_score >= 3):
-        return "Em Risco"
-    elif r_score == 1 and f_score <= 2:
-        return "Perdido"
-    else:
-        return "Regular"
+    from app.services.rfm_service import RFMService
 
-
-
-def analise_rfm_clientes(estabelecimento_id: int, days: int = 180, data_inicio: datetime = None, data_fim: datetime = None) -> List[Dict[str, Any]]:
-    """
-    Análise RFM completa de clientes com queries otimizadas.
-    
-    OTIMIZAÇÃO: Usa SQLAlchemy aggregations para processar no banco.
-    """
-    # O banco grava datetimes UTC "naive" (utcnow). Usar datetime.now(timezone.utc)
-    # (aware) quebrava a subtração `now - ultima_compra` com o erro
-    # "can't subtract offset-naive and offset-aware datetimes" (RFM e resumo davam 500).
     if data_inicio:
-        if not data_fim:
-            data_fim = datetime.utcnow()
+        # O banco grava datetimes UTC "naive" (utcnow); aware quebrava a subtração
+        # `now - ultima_compra` ("can't subtract offset-naive and offset-aware").
+        data_inicio = data_inicio.replace(tzinfo=None)
+        data_fim = data_fim.replace(tzinfo=None) if data_fim else None
+        clientes = RFMService.calcular_metricas(
+            None if str(estabelecimento_id).lower() == 'all' else estabelecimento_id,
+            janela_dias=days, data_inicio=data_inicio, data_fim=data_fim,
+        )
+        if clientes:
+            ids = [c["cliente_id"] for c in clientes]
+            dados = {
+                c.id: c for c in db.session.query(
+                    Cliente.id, Cliente.nome, Cliente.email, Cliente.celular
+                ).filter(Cliente.id.in_(ids)).all()
+            }
+            for c in clientes:
+                cli = dados.get(c["cliente_id"])
+                c["nome"] = cli.nome if cli else None
+                c["email"] = cli.email if cli else None
+                c["celular"] = cli.celular if cli else None
+                c["rfm_score"] = f"{c['recency_score']}{c['frequency_score']}{c['monetary_score']}"
+            clientes.sort(key=lambda x: x['monetary'], reverse=True)
     else:
-        # Padrão: últimos X dias
-        data_fim = datetime.utcnow()
-        data_inicio = data_fim - timedelta(days=days)
-    
-    # Query otimizada: agrupa no banco de dados
-    resultados = db.session.query(
-        Venda.cliente_id,
-        Cliente.nome.label('cliente_nome'),
-        Cliente.email.label('cliente_email'),
-        Cliente.celular.label('cliente_celular'),
-        func.count(Venda.id).label('frequency'),
-        func.sum(Venda.total).label('monetary'),
-        func.max(Venda.data_venda).label('ultima_compra')
-    ).join(
-        Cliente, Venda.cliente_id == Cliente.id
-    ).filter(
-        Venda.estabelecimento_id == estabelecimento_id if str(estabelecimento_id).lower() != 'all' else True,
-        Venda.data_venda >= data_inicio,
-        Venda.data_venda <= data_fim,
-        Venda.status == 'finalizada',
-        Venda.cliente_id.isnot(None)
-    ).group_by(
-        Venda.cliente_id,
-        Cliente.nome,
-        Cliente.email,
-        Cliente.celular
-    ).all()
-    
-    if not resultados:
-        return []
-    
-    # Processar resultados (now naive UTC, coerente com o banco)
-    now = datetime.utcnow()
-    clientes_rfm = []
-
-    for row in resultados:
-        recency_days = (now - row.ultima_compra).days if row.ultima_compra else days
-        frequency = int(row.frequency or 0)
-        monetary = float(row.monetary or 0)
-        
-        # Calcular scores
-        r_score, f_score, m_score = calcular_score_rfm(recency_days, frequency, monetary)
-        
-        # Segmentar
-        segmento = segmentar_cliente_rfm(r_score, f_score, m_score)
-        
-        # Flag de risco
-        em_risco = segmento in ["Em Risco", "Perdido"]
-        
-        clientes_rfm.append({
-            "cliente_id": row.cliente_id,
-            "nome": row.cliente_nome,
-            "email": row.cliente_email,
-            "celular": row.cliente_celular,
-            "recency_days": recency_days,
-            "recency_score": r_score,
-            "frequency": frequency,
-            "frequency_score": f_score,
-            "monetary": round(monetary, 2),
-            "monetary_score": m_score,
-            "segmento": segmento,
-            "em_risco": em_risco,
-            "ultima_compra": iso_local(row.ultima_compra),
-            "ultima_compra_fmt": fmt_local(row.ultima_compra, "%d/%m/%Y"),
-            "rfm_score": f"{r_score}{f_score}{m_score}"
-        })
-    
-    # Ordenar por valor monetário (clientes mais valiosos primeiro)
-    clientes_rfm.sort(key=lambda x: x['monetary'], reverse=True)
-    
-    return clientes_rfm
+        clientes = RFMService.listar_scores(estabelecimento_id, janela_dias=days)
+
+    # Ordem do motor: clientes mais valiosos primeiro
+    return [
+        {
+            "cliente_id": c["cliente_id"],
+            "nome": c["nome"],
+            "email": c["email"],
+            "celular": c["celular"],
+            "recency_days": c["recency_days"],
+            "recency_score": c["recency_score"],
+            "frequency": c["frequency"],
+            "frequency_score": c["frequency_score"],
+            "monetary": c["monetary"],
+            "monetary_score": c["monetary_score"],
+            "segmento": c["segmento"],
+            "em_risco": c["segmento"] in RFMService.SEGMENTOS_RISCO,
+            "ultima_compra": iso_local(c["ultima_compra"]),
+            "ultima_compra_fmt": fmt_local(c["ultima_compra"], "%d/%m/%Y"),
+            "rfm_score": c["rfm_score"],
+        }
+        for c in clientes
+    ]
 
 
 
@@ -735,10 +647,12 @@ def exportar_backup_local():
     Exporta backup completo do sistema com metadados para Power BI.
     
     FEATURES:
-    - Exportação otimizada com Pandas
+    - Streaming: tabelas lidas em lotes por cursor e escritas direto no ZIP
+      (memória constante, mesmo com milhões de itens de venda)
+    - Uma tabela por arquivo: ?formato=csv (padrão) | ndjson | parquet
+    - Incremental: ?desde=<X-Backup-Cursor da exportação anterior>
+    - Retomada: ?cursor=<X-Backup-Cursor>&apos=<tabela>:<último id recebido>
     - Dicionário de dados incluído
-    - Formato compatível com Power BI
-    - Compressão ZIP
     """
     try:
         from app.utils.query_helpers import get_authorized_establishment_id
@@ -807,77 +721,32 @@ def exportar_backup_local():
             }
         }
         
-        # Exportar dados usando Pandas (otimizado)
-        import pandas as pd  # lazy: só carrega quando alguém exporta backup
-        current_app.logger.info("Iniciando exportação de backup...")
-        
-        # Produtos
-        produtos_query = Produto.query.filter_by(estabelecimento_id=estabelecimento_id).all()
-        df_produtos = pd.DataFrame([p.to_dict() for p in produtos_query])
-        
-        # Clientes
-        clientes_query = Cliente.query.filter_by(estabelecimento_id=estabelecimento_id).all()
-        df_clientes = pd.DataFrame([c.to_dict() for c in clientes_query])
-        
-        # Vendas
-        vendas_query = Venda.query.filter_by(estabelecimento_id=estabelecimento_id).all()
-        df_vendas = pd.DataFrame([v.to_dict() for v in vendas_query])
-        
-        # Itens de venda
-        venda_ids = [v.id for v in vendas_query]
-        if venda_ids:
-            itens_query = VendaItem.query.filter(VendaItem.venda_id.in_(venda_ids)).all()
-            df_itens = pd.DataFrame([i.to_dict() for i in itens_query])
-        else:
-            df_itens = pd.DataFrame()
-        
-        # Criar arquivo Excel com múltiplas abas
-        excel_buffer = io.BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            # Dicionário de dados
-            df_metadata = pd.DataFrame([dicionario_dados])
-            df_metadata.to_excel(writer, sheet_name='Dicionário de Dados', index=False)
-            
-            # Dados
-            if not df_produtos.empty:
-                df_produtos.to_excel(writer, sheet_name='Produtos', index=False)
-            if not df_clientes.empty:
-                df_clientes.to_excel(writer, sheet_name='Clientes', index=False)
-            if not df_vendas.empty:
-                df_vendas.to_excel(writer, sheet_name='Vendas', index=False)
-            if not df_itens.empty:
-                df_itens.to_excel(writer, sheet_name='Itens de Venda', index=False)
-        
-        excel_buffer.seek(0)
-        
-        # Criar ZIP
-        mem_zip = io.BytesIO()
-        with zipfile.ZipFile(mem_zip, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            zf.writestr(f"mercadinhosys_backup_{ts}.xlsx", excel_buffer.getvalue())
-            
-            # Adicionar JSON também (para compatibilidade)
-            data_json = {
-                "timestamp": ts,
-                "metadata": dicionario_dados["metadata"],
-                "produtos": df_produtos.to_dict('records') if not df_produtos.empty else [],
-                "clientes": df_clientes.to_dict('records') if not df_clientes.empty else [],
-                "vendas": df_vendas.to_dict('records') if not df_vendas.empty else [],
-                "itens_venda": df_itens.to_dict('records') if not df_itens.empty else []
-            }
-            json_bytes = json.dumps(data_json, ensure_ascii=False, indent=2).encode("utf-8")
-            zf.writestr(f"backup_{ts}.json", json_bytes)
-        
-        mem_zip.seek(0)
-        
+        # Streaming: cada tabela sai em lotes direto para o ZIP (memória constante)
+        from app.services import backup_stream
+        try:
+            cursor, gerador = backup_stream.exportar_zip(
+                estabelecimento_id,
+                tabelas=["produtos", "clientes", "vendas", "venda_itens"],
+                formato=request.args.get("formato", "csv"),
+                desde=request.args.get("desde"),
+                apos=request.args.get("apos"),
+                cursor=request.args.get("cursor"),
+                extras={"dicionario_dados.json": json.dumps(dicionario_dados, ensure_ascii=False, indent=2)},
+            )
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
         filename = f"mercadinhosys_backup_{ts}.zip"
-        
-        current_app.logger.info(f"Backup exportado com sucesso: {filename}")
-        
-        return send_file(
-            mem_zip,
+        current_app.logger.info(f"Iniciando exportação de backup em streaming: {filename}")
+        return Response(
+            stream_with_context(gerador),
             mimetype="application/zip",
-            as_attachment=True,
-            download_name=filename
+            headers={
+                "Content-Disposition": f"attachment; filename={filename}",
+                # Devolvido em ?desde= na próxima exportação → só o que mudou
+                "X-Backup-Cursor": cursor,
+                "Access-Control-Expose-Headers": "X-Backup-Cursor, Content-Disposition",
+            },
         )
         
     except Exception as e:
@@ -885,6 +754,38 @@ def exportar_backup_local():
         return jsonify({"success": False, "error": "Falha ao exportar backup"}), 500
 
 
+@relatorios_bp.route("/exportacoes/<handle>", methods=["GET"])
+@funcionario_required
+def status_exportacao(handle):
+    """Status de uma exportação em background (?assincrono=true nas rotas /exportar)."""
+    from app.services.exportacao_service import ExportacaoService
+    from app.utils.query_helpers import get_authorized_establishment_id
+
+    job = ExportacaoService.localizar(handle, get_authorized_establishment_id())
+    if job is None:
+        return jsonify({"success": False, "error": "Exportação não encontrada"}), 404
+    return jsonify({"success": True, "exportacao": job.to_dict()})
+
+
+@relatorios_bp.route("/exportacoes/<handle>/arquivo", methods=["GET"])
+@funcionario_required
+def baixar_exportacao(handle):
+    """Download do arquivo gerado em background (até expirar)."""
+    import os
+    from app.services.exportacao_service import MIMETYPE_XLSX, ExportacaoService
+    from app.utils.query_helpers import get_authorized_establishment_id
+
+    job = ExportacaoService.localizar(handle, get_authorized_establishment_id())
+    if job is None:
+        return jsonify({"success": False, "error": "Exportação não encontrada"}), 404
+    if job.status != "pronto":
+        return jsonify({"success": False, "exportacao": job.to_dict()}), 409
+    if not job.caminho or not os.path.exists(job.caminho):
+        return jsonify({"success": False, "error": "Arquivo expirado"}), 410
+    mimetype = MIMETYPE_XLSX if job.formato == "xlsx" else "text/csv"
+    return send_file(job.caminho, mimetype=mimetype, as_attachment=True, download_name=job.nome_arquivo, max_age=0)
+
+
 @relatorios_bp.route("/dashboard/resumo", methods=["GET"])
 @funcionario_required
 def get_dashboard_resumo():
@@ -7,7 +7,6 @@ from flask_jwt_extended import get_jwt, jwt_required
 from datetime import datetime, date
 from decimal import Decimal
 import os
-import uuid
 
 from app.models import (
     db,
@@ -18,6 +17,7 @@ from app.models import (
 )
 from app.decorators.decorator_jwt import funcionario_required, gerente_ou_admin_required
 from app.decorators.plan_guards import plan_required
+from app.services.midia_service import MidiaService
 from app.dashboard_cientifico.data_layer import DataLayer
 
 rh_bp = Blueprint("rh", __name__)
@@ -205,10 +205,8 @@ def criar_justificativa():
             }), 403
 
         # Salvar documento se enviado (atestado, foto de pneu furado, etc.)
-        documento_url = None
+        midia = None
         if documento:
-            from werkzeug.utils import secure_filename
-
             EXTENSOES_PERMITIDAS = {"pdf", "jpg", "jpeg", "png"}
             TAMANHO_MAXIMO_BYTES = 5 * 1024 * 1024  # 5MB
 
@@ -228,35 +226,10 @@ def criar_justificativa():
                     "message": "Documento muito grande. Tamanho máximo: 5MB.",
                 }), 400
 
-            nome_seguro = secure_filename(documento.filename) or f"documento.{extensao}"
-            filename = f"just_{funcionario_id}_{data_str}_{uuid.uuid4().hex[:8]}_{nome_seguro}"
-
-            if os.getenv("CLOUDINARY_URL"):
-                try:
-                    import cloudinary.uploader
-                    import base64
-                    doc_bytes = documento.read()
-                    doc_b64 = f"data:{documento.content_type};base64,{base64.b64encode(doc_bytes).decode('utf-8')}"
-                    
-                    result = cloudinary.uploader.upload(
-                        doc_b64,
-                        folder="mercadinhosys/justificativas",
-                        public_id=filename.rsplit(".", 1)[0],
-                        resource_type="auto"
-                    )
-                    documento_url = result.get("secure_url")
-                except Exception as e:
-                    current_app.logger.error(f"Erro Cloudinary (justificativa): {e}")
-                    documento_url = None
-            
-            if not documento_url:
-                # Fallback local
-                documento.seek(0)
-                upload_dir = os.path.join(current_app.config.get("UPLOAD_FOLDER", "uploads"), "justificativas")
-                os.makedirs(upload_dir, exist_ok=True)
-                filepath = os.path.join(upload_dir, filename)
-                documento.save(filepath)
-                documento_url = f"/uploads/justificativas/{filename}"
+            # Spool do pipeline de mídia: otimização e upload saem em background
+            midia = MidiaService.receber_arquivo(
+                documento, "justificativas", f"just_{funcionario_id}_{data_str}", estabelecimento_id
+            )
 
         justificativa = JustificativaPonto(
             estabelecimento_id=estabelecimento_id,
@@ -264,12 +237,15 @@ def criar_justificativa():
             tipo=tipo,
             data=datetime.strptime(data_str, "%Y-%m-%d").date(),
             motivo=motivo,
-            documento_url=documento_url,
             status="pendente",
         )
 
         db.session.add(justificativa)
+        if midia:
+            MidiaService.vincular(midia, justificativa, "documento_url")
         db.session.commit()
+        if midia:
+            MidiaService.despachar(midia)
 
         return jsonify({
             "success": True,
@@ -322,6 +298,10 @@ def responder_justificativa(justificativa_id):
         justificativa.aprovador_id = user_id
         justificativa.data_resposta = datetime.now(timezone.utc)
 
+        # Aprovação abona o débito do dia no banco de horas (rejeição desfaz)
+        from app.services.banco_horas_service import BancoHorasService
+        BancoHorasService.reavaliar_dia(justificativa.funcionario_id, justificativa.estabelecimento_id,
+                                        justificativa.data, referencia_id=justificativa.id)
         db.session.commit()
 
         return jsonify({
@@ -556,6 +536,119 @@ def listar_banco_horas():
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+@rh_bp.route("/banco-horas/saldo", methods=["GET"])
+@funcionario_required
+@plan_required('Pro')
+def saldo_banco_horas():
+    """Saldo do banco de horas agora ou em ``em`` (ISO datetime), lido do último
+    lançamento do razão. Self-service: quem não é gestão só vê o próprio."""
+    from app.services.banco_horas_service import BancoHorasService
+
+    usuario = _usuario_atual()
+    if not usuario:
+        return jsonify({"success": False, "message": "Funcionário não encontrado"}), 404
+    alvo_id = request.args.get("funcionario_id", type=int) or usuario.id
+    if alvo_id != usuario.id and not _pode_ver_tudo_rh(usuario):
+        return jsonify({"success": False, "message": "Você só pode ver o próprio banco de horas"}), 403
+    alvo = _carregar_funcionario_do_tenant(alvo_id)
+    if not alvo:
+        return jsonify({"success": False, "message": "Funcionário não encontrado"}), 404
+    em = request.args.get("em")
+    try:
+        em = datetime.fromisoformat(em) if em else None
+    except ValueError:
+        return jsonify({"success": False, "message": "'em' deve ser data/hora ISO"}), 400
+    if em is not None and em.tzinfo is not None:
+        em = em.astimezone(timezone.utc).replace(tzinfo=None)
+
+    ultimo = BancoHorasService.ultimo(alvo.id, em)
+    saldo = ultimo.saldo_minutos if ultimo else 0
+    return jsonify({"success": True, "data": {
+        "funcionario_id": alvo.id,
+        "saldo_minutos": saldo,
+        "saldo_horas": round(saldo / 60.0, 2),
+        "ultimo_lancamento_em": ultimo.criado_em.replace(tzinfo=timezone.utc).isoformat() if ultimo else None,
+        "sequencia": ultimo.sequencia if ultimo else 0,
+    }})
+
+
+@rh_bp.route("/banco-horas/extrato", methods=["GET"])
+@funcionario_required
+@plan_required('Pro')
+def extrato_banco_horas():
+    """Lançamentos do razão do funcionário (mais recentes primeiro), paginados."""
+    import math
+    from app.models import BancoHorasLancamento
+
+    usuario = _usuario_atual()
+    if not usuario:
+        return jsonify({"success": False, "message": "Funcionário não encontrado"}), 404
+    alvo_id = request.args.get("funcionario_id", type=int) or usuario.id
+    if alvo_id != usuario.id and not _pode_ver_tudo_rh(usuario):
+        return jsonify({"success": False, "message": "Você só pode ver o próprio banco de horas"}), 403
+    alvo = _carregar_funcionario_do_tenant(alvo_id)
+    if not alvo:
+        return jsonify({"success": False, "message": "Funcionário não encontrado"}), 404
+
+    pagina = request.args.get("pagina", 1, type=int)
+    por_pagina = min(request.args.get("por_pagina", 50, type=int), 200)
+    query = BancoHorasLancamento.query.filter(BancoHorasLancamento.funcionario_id == alvo.id)
+    total = query.count()
+    lancamentos = (query.order_by(BancoHorasLancamento.sequencia.desc())
+                   .limit(por_pagina).offset((pagina - 1) * por_pagina).all())
+    return jsonify({
+        "success": True,
+        "data": [{
+            "sequencia": l.sequencia,
+            "data": l.data.isoformat(),
+            "origem": l.origem,
+            "referencia_id": l.referencia_id,
+            "minutos_trabalhados": l.minutos_trabalhados,
+            "minutos_esperados": l.minutos_esperados,
+            "valor_dia": l.valor_dia,
+            "delta_minutos": l.delta_minutos,
+            "saldo_minutos": l.saldo_minutos,
+            "criado_em": l.criado_em.replace(tzinfo=timezone.utc).isoformat() if l.criado_em else None,
+        } for l in lancamentos],
+        "total": total,
+        "pagina": pagina,
+        "por_pagina": por_pagina,
+        "total_paginas": math.ceil(total / por_pagina) if total > 0 else 1,
+    })
+
+
+@rh_bp.route("/banco-horas/verificar", methods=["POST"])
+@funcionario_required
+@plan_required('Pro')
+def verificar_banco_horas():
+    """Confere o razão contra as batidas e justificativas do intervalo;
+    ``corrigir`` grava lançamentos de reconciliação (Admin/Gerente/RH)."""
+    if not _pode_ver_tudo_rh(_usuario_atual()):
+        return jsonify({"success": False, "message": "Apenas Admin, Gerente ou RH conferem o banco de horas"}), 403
+    from app.services.banco_horas_service import BancoHorasService
+    from app.utils.query_helpers import get_authorized_establishment_id
+
+    estab_id = get_authorized_establishment_id()
+    if not estab_id or str(estab_id).lower() == "all":
+        return jsonify({"success": False, "message": "Selecione um estabelecimento"}), 400
+    payload = request.get_json(silent=True) or {}
+    try:
+        inicio = date.fromisoformat(payload["data_inicio"]) if payload.get("data_inicio") else None
+        fim = date.fromisoformat(payload["data_fim"]) if payload.get("data_fim") else None
+    except ValueError:
+        return jsonify({"success": False, "message": "Datas devem ser YYYY-MM-DD"}), 400
+    try:
+        resultado = BancoHorasService.verificar(
+            estabelecimento_id=estab_id, data_inicio=inicio, data_fim=fim,
+            funcionario_id=payload.get("funcionario_id"), corrigir=bool(payload.get("corrigir")),
+        )
+        return jsonify({"success": True, "data": resultado})
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erro ao verificar banco de horas: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
 # ============================================
 # FOLHA — RESCISÃO E PROVISÕES (Admin/Gerente/RH)
 # ============================================
@@ -956,6 +1049,99 @@ def atualizar_configuracao_folha():
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+# ============================================
+# PROCESSAMENTO DA FOLHA (lote por competência)
+# ============================================
+
+def _ao_vivo():
+    """``?ao_vivo=true`` ignora o snapshot e recalcula na hora."""
+    return request.args.get("ao_vivo", "").lower() in ("1", "true", "sim")
+
+
+def _processamento_vigente(estab_id, mes_referencia):
+    """Versão vigente do processamento do mês (None se não processado ou ao vivo)."""
+    from app.services.folha_service import FolhaService
+    if _ao_vivo() or not estab_id or str(estab_id).lower() == "all":
+        return None
+    return FolhaService.ultimo(estab_id, mes_referencia)
+
+
+def _item_processado(funcionario, mes_referencia):
+    """Linha do funcionário na versão vigente do mês (None se não processado ou ao vivo)."""
+    from app.services.folha_service import FolhaService
+    if _ao_vivo():
+        return None
+    return FolhaService.item(funcionario.estabelecimento_id, mes_referencia, funcionario.id)
+
+
+def _meta_processamento(origem):
+    """Identificação do snapshot servido (processamento ou linha de um processamento)."""
+    processamento = getattr(origem, "processamento", None) or origem
+    return {"id": processamento.id, "versao": processamento.versao,
+            "mes_referencia": processamento.mes_referencia, "criado_em": processamento.to_dict()["criado_em"]}
+
+
+@rh_bp.route("/folha/processar", methods=["POST"])
+@funcionario_required
+@plan_required('Pro')
+def processar_folha():
+    """Processa a folha do mês da loja inteira e grava um snapshot versionado.
+    Só recalcula quem teve ponto, salário, benefícios ou vendas alterados;
+    ``forcar`` (true ou lista de ids) recalcula mesmo sem mudança."""
+    usuario = _usuario_atual()
+    if not _pode_ver_tudo_rh(usuario):
+        return jsonify({"success": False, "message": "Apenas Admin, Gerente ou RH processam a folha"}), 403
+    from app.services.folha_service import FolhaService
+    from app.utils.query_helpers import get_authorized_establishment_id
+
+    estab_id = get_authorized_establishment_id()
+    if not estab_id or str(estab_id).lower() == "all":
+        return jsonify({"success": False, "message": "Selecione um estabelecimento"}), 400
+    payload = request.get_json(silent=True) or {}
+    mes_referencia = payload.get("mes_referencia") or date.today().strftime("%Y-%m")
+    try:
+        datetime.strptime(mes_referencia, "%Y-%m")
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "mes_referencia deve ser YYYY-MM"}), 400
+    forcar = payload.get("forcar") or False
+    if not isinstance(forcar, (bool, list)):
+        return jsonify({"success": False, "message": "forcar deve ser booleano ou lista de funcionario_id"}), 400
+
+    try:
+        processamento = FolhaService.processar(estab_id, mes_referencia, forcar=forcar, criado_por_id=usuario.id)
+        return jsonify({"success": True, "data": processamento.to_dict()}), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erro ao processar folha: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@rh_bp.route("/folha/<mes_referencia>", methods=["GET"])
+@funcionario_required
+@plan_required('Pro')
+def obter_folha_processada(mes_referencia):
+    """Versão vigente do processamento do mês com a linha de cada funcionário."""
+    if not _pode_ver_tudo_rh(_usuario_atual()):
+        return jsonify({"success": False, "message": "Apenas Admin, Gerente ou RH acessam a folha"}), 403
+    from app.services.folha_service import FolhaService
+    from app.utils.query_helpers import get_authorized_establishment_id
+
+    estab_id = get_authorized_establishment_id()
+    processamento = _processamento_vigente(estab_id, mes_referencia)
+    if processamento is None:
+        return jsonify({"success": False, "message": "Folha do mês ainda não processada"}), 404
+    itens = [{
+        "funcionario_id": i.funcionario_id,
+        "nome": i.holerite_json.get("nome"),
+        "cargo": i.holerite_json.get("cargo"),
+        "liquido": float(i.liquido or 0),
+        "custo_real": float(i.custo_real or 0),
+        "totais": i.holerite_json.get("totais"),
+        "recalculado": i.recalculado,
+    } for i in FolhaService.itens(processamento)]
+    return jsonify({"success": True, "data": processamento.to_dict(), "itens": itens}), 200
+
+
 @rh_bp.route("/holerite", methods=["GET"])
 @funcionario_required
 @plan_required('Pro')
@@ -977,6 +1163,10 @@ def holerite_funcionario():
 
     mes_referencia = request.args.get("mes_referencia") or date.today().strftime("%Y-%m")
     try:
+        item = _item_processado(alvo, mes_referencia)
+        if item is not None:
+            return jsonify({"success": True, "data": item.holerite_json,
+                            "processamento": _meta_processamento(item)}), 200
         return jsonify({"success": True, "data": calcular_holerite(alvo, mes_referencia)}), 200
     except Exception as e:
         current_app.logger.error(f"Erro ao calcular holerite: {e}")
@@ -1012,6 +1202,10 @@ def retrospectiva():
     else:
         ano_mes = request.args.get("ano_mes") or date.today().strftime("%Y-%m")
         data_inicio, data_fim = limites_do_mes(ano_mes)
+        item = _item_processado(alvo, ano_mes)
+        if item is not None:
+            return jsonify({"success": True, "data": item.retrospectiva_json,
+                            "processamento": _meta_processamento(item)}), 200
 
     try:
         dados = calcular_retrospectiva(alvo, data_inicio, data_fim)
@@ -1035,6 +1229,7 @@ def listar_provisoes():
 
         estab_id = get_authorized_establishment_id()
         ano_mes = request.args.get("ano_mes") or date.today().strftime("%Y-%m")
+        processamento = _processamento_vigente(estab_id, ano_mes)
         regime = None
         try:
             from app.models import Estabelecimento
@@ -1043,27 +1238,31 @@ def listar_provisoes():
         except Exception:
             regime = None
 
-        q = Funcionario.query.filter_by(ativo=True)
-        if estab_id and str(estab_id).lower() != "all":
-            q = q.filter_by(estabelecimento_id=estab_id)
-        funcionarios = q.all()
-
-        from sqlalchemy import func
-        from app.models import FuncionarioBeneficio
-        
-        query_ben = db.session.query(
-            FuncionarioBeneficio.funcionario_id,
-            func.sum(FuncionarioBeneficio.valor)
-        ).filter(FuncionarioBeneficio.ativo == True).group_by(FuncionarioBeneficio.funcionario_id)
-        beneficios_map = dict(query_ben.all())
-
-        itens = []
-        for f in funcionarios:
-            prov = calcular_provisoes(f, ano_mes, regime)
-            ben = float(beneficios_map.get(f.id, 0.0))
-            prov["beneficios"] = round(ben, 2)
-            prov["custo_real"] = round(prov["custo_real"] + ben, 2)
-            itens.append(prov)
+        if processamento is not None:
+            from app.services.folha_service import FolhaService
+            itens = [i.provisoes_json for i in FolhaService.itens(processamento)]
+        else:
+            q = Funcionario.query.filter_by(ativo=True)
+            if estab_id and str(estab_id).lower() != "all":
+                q = q.filter_by(estabelecimento_id=estab_id)
+            funcionarios = q.all()
+
+            from sqlalchemy import func
+            from app.models import FuncionarioBeneficio
+
+            query_ben = db.session.query(
+                FuncionarioBeneficio.funcionario_id,
+                func.sum(FuncionarioBeneficio.valor)
+            ).filter(FuncionarioBeneficio.ativo == True).group_by(FuncionarioBeneficio.funcionario_id)
+            beneficios_map = dict(query_ben.all())
+
+            itens = []
+            for f in funcionarios:
+                prov = calcular_provisoes(f, ano_mes, regime)
+                ben = float(beneficios_map.get(f.id, 0.0))
+                prov["beneficios"] = round(ben, 2)
+                prov["custo_real"] = round(prov["custo_real"] + ben, 2)
+                itens.append(prov)
 
         folha_nominal = round(sum(i["salario_base"] for i in itens), 2)
 
@@ -1092,6 +1291,7 @@ def listar_provisoes():
                 "custo_real_total": custo_total,
                 "provisionamento_total": round(custo_total - folha_nominal - total_beneficios, 2),
             },
+            "processamento": _meta_processamento(processamento) if processamento is not None else None,
         }), 200
     except Exception as e:
         current_app.logger.error(f"Erro ao listar provisões: {e}")
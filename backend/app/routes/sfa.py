@@ -11,6 +11,7 @@ from decimal import Decimal
 import re
 import calendar as cal_lib
 from sqlalchemy import func
+from app.utils.timezone import hoje_local, intervalo_utc
 
 bp = Blueprint("sfa", __name__)
 
@@ -168,8 +169,11 @@ def kpi_vendedor():
         if not vendedor_id or not estab_id:
             return jsonify({"status": "error", "message": "Contexto de vendedor/estabelecimento ausente"}), 400
 
-        hoje = datetime.now(timezone.utc).date()
+        hoje = hoje_local()
         ano, mes = hoje.year, hoje.month
+        # Mês corrente como faixa [de, ate) em data_emissao: usa o índice
+        # (estabelecimento_id, data_emissao, status) em vez de EXTRACT(month/year)
+        inicio_mes, fim_mes = intervalo_utc(hoje.replace(day=1), hoje.replace(day=cal_lib.monthrange(ano, mes)[1]))
 
         # 1. Meta do Vendedor (raw SQL sempre restrito ao tenant)
         meta_row = db.session.execute(
@@ -187,12 +191,11 @@ def kpi_vendedor():
                 FROM pedidos_venda
                 WHERE vendedor_id = :vid
                   AND estabelecimento_id = :eid
-                  AND EXTRACT(month FROM data_emissao) = :mes
-                  AND EXTRACT(year FROM data_emissao) = :ano
+                  AND data_emissao >= :inicio AND data_emissao < :fim
                   AND status != 'cancelado'
                   AND (deleted_at IS NULL)
             """),
-            {"vid": vendedor_id, "mes": mes, "ano": ano, "eid": estab_id}
+            {"vid": vendedor_id, "inicio": inicio_mes, "fim": fim_mes, "eid": estab_id}
         ).mappings().all()
 
         faturamento_realizado = sum(float(p["total"]) for p in pedidos_rows)
@@ -236,12 +239,11 @@ def kpi_vendedor():
                     JOIN pedidos_venda pv ON pv.id = pvi.pedido_id
                     WHERE pv.vendedor_id = :vid
                       AND pv.estabelecimento_id = :eid
-                      AND EXTRACT(month FROM pv.data_emissao) = :mes
-                      AND EXTRACT(year FROM pv.data_emissao) = :ano
+                      AND pv.data_emissao >= :inicio AND pv.data_emissao < :fim
                       AND pv.status != 'cancelado'
                       AND pvi.produto_id IN ({foco_ids})
                 """),
-                {"vid": vendedor_id, "mes": mes, "ano": ano, "eid": estab_id}
+                {"vid": vendedor_id, "inicio": inicio_mes, "fim": fim_mes, "eid": estab_id}
             ).mappings().first()
             foco_vendido = float(itens_foco["total"]) if itens_foco else 0.0
 
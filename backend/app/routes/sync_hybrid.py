@@ -4,10 +4,11 @@ Sistema Híbrido - Sincronização Local ↔ Cloud
 Utiliza modelos SQLAlchemy para garantir integridade dos dados.
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt
 import json
 import os
+import zipfile
 from datetime import datetime
 import logging
 from app import db
@@ -25,6 +26,7 @@ from app.models import (
     Despesa,
     SyncQueue,
 )
+from app.services import backup_stream
 
 sync_hybrid_bp = Blueprint('sync_hybrid', __name__)
 logger = logging.getLogger(__name__)
@@ -178,70 +180,99 @@ def sync_download():
         logger.error(f"Erro no download: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _pasta_backups():
+    return current_app.config.get('BACKUP_FOLDER') or '/app/backups'
+
+
+def _tenant_do_token(claims):
+    if claims.get('is_super_admin'):
+        return claims.get('estabelecimento_id') or 'all'
+    return claims.get('estabelecimento_id')
+
+
+def _ultimo_cursor(pasta, prefixo):
+    """Cursor do backup mais recente do tenant (lido do manifesto do ZIP)."""
+    anteriores = sorted(n for n in os.listdir(pasta) if n.startswith(prefixo) and n.endswith('.zip'))
+    if not anteriores:
+        return None
+    with zipfile.ZipFile(os.path.join(pasta, anteriores[-1])) as zf:
+        return json.loads(zf.read('manifesto.json')).get('cursor')
+
+
 @sync_hybrid_bp.route('/backup', methods=['POST'])
 @jwt_required()
 def create_backup():
-    """Cria um backup local dos dados em JSON."""
+    """
+    Cria um backup local em ZIP (um NDJSON por tabela), gravado em streaming.
+    Com {"incremental": true}, inclui só o que mudou desde o último backup da loja.
+    """
     try:
-        export_data = {}
-        for model in MODELS:
-            export_data[model.__tablename__] = export_model_data(model)
-        
+        data = request.get_json(silent=True) or {}
+        estabelecimento_id = _tenant_do_token(get_jwt())
+        pasta = _pasta_backups()
+        os.makedirs(pasta, exist_ok=True)
+        prefixo = f"backup_{estabelecimento_id}_"
+        desde = data.get('desde') or (_ultimo_cursor(pasta, prefixo) if data.get('incremental') else None)
+
+        cursor, gerador = backup_stream.exportar_zip(estabelecimento_id, formato='ndjson', desde=desde)
         timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
-        filename = f"backup_{timestamp}.json"
-        
-        # Salvar localmente (opcional)
-        backup_path = os.path.join('/app/backups', filename)
-        os.makedirs('/app/backups', exist_ok=True)
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            json.dump(export_data, f, ensure_ascii=False, indent=2)
-        
+        filename = f"{prefixo}{timestamp}{'_inc' if desde else ''}.zip"
+        backup_path = os.path.join(pasta, filename)
+        tamanho = backup_stream.gravar_zip(backup_path, gerador)
+
         return jsonify({
             'success': True,
             'filename': filename,
-            'tables': len(export_data),
+            'tables': len(MODELS),
+            'incremental': bool(desde),
+            'cursor': cursor,
+            'bytes': tamanho,
             'path': backup_path
         })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
+        logger.error(f"Erro no backup: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @sync_hybrid_bp.route('/restore', methods=['POST'])
 @jwt_required()
 def restore_backup():
-    """Restaura dados a partir de um arquivo de backup JSON."""
+    """Restaura um backup (ZIP em NDJSON, ou o JSON legado) com upsert em lotes."""
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         filename = data.get('filename')
         if not filename:
             return jsonify({'success': False, 'error': 'Nome do arquivo não fornecido'}), 400
         
-        backup_path = os.path.join('/app/backups', filename)
+        backup_path = os.path.join(_pasta_backups(), os.path.basename(filename))
         if not os.path.exists(backup_path):
             return jsonify({'success': False, 'error': 'Arquivo de backup não encontrado'}), 404
-        
-        with open(backup_path, 'r', encoding='utf-8') as f:
-            backup_data = json.load(f)
-        
-        restored = {}
-        for table_name, rows in backup_data.items():
-            model = next((m for m in MODELS if m.__tablename__ == table_name), None)
-            if not model:
-                continue
-            
-            count = 0
-            for row in rows:
-                row.pop('id', None)
-                obj = model(**row)
-                db.session.add(obj)
-                count += 1
-            restored[table_name] = count
-        
-        db.session.commit()
+
+        estabelecimento_id = _tenant_do_token(get_jwt())
+        if backup_path.endswith('.zip'):
+            restored = backup_stream.restaurar_zip(backup_path, estabelecimento_id)
+        else:
+            # Formato antigo (um JSON com todas as tabelas)
+            with open(backup_path, 'r', encoding='utf-8') as f:
+                backup_data = json.load(f)
+            restored = {}
+            for model in MODELS:
+                rows = backup_data.get(model.__tablename__)
+                if rows:
+                    restored[model.__tablename__] = backup_stream.restaurar_linhas(
+                        model.__tablename__, rows, estabelecimento_id)
+            db.session.commit()
+            backup_stream.reconciliar_razao(restored, estabelecimento_id)
+
         return jsonify({
             'success': True,
             'restored': restored,
             'message': 'Backup restaurado com sucesso'
         })
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'success': False, 'error': str(e)}), 500
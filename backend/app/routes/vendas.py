@@ -3,7 +3,7 @@ from datetime import timezone
 # Compatível com o novo models.py (tabela Pagamento)
 # Todas as rotas originais mantidas e funcionais.
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 from flask import Blueprint, request, jsonify, Response, current_app
 from app import db
@@ -24,13 +24,17 @@ from app.models import (
 )
 from flask_jwt_extended import jwt_required, get_jwt
 from app.decorators.plan_guards import permission_required, normalize_plan
-from app.utils.query_helpers import ilike_unaccent, get_authorized_establishment_id, get_dow_extract, get_hour_extract
+from app.utils.query_helpers import (
+    ilike_unaccent, get_authorized_establishment_id, get_dow_extract, get_hour_extract, get_string_agg,
+)
+from app.services.carrinho_service import CarrinhoConflito, CarrinhoErro, CarrinhoService
+from app.services.venda_service import VendaService
+from app.utils.errors import VendaJaCanceladaError
+from app.services.exportacao_service import Coluna, Exportacao, registrar_exportacao, responder
 from sqlalchemy import or_, func, distinct, select
 from collections import defaultdict
 import random
 import string
-import io
-import csv
 
 vendas_bp = Blueprint("vendas", __name__)
 
@@ -90,6 +94,31 @@ def gerar_codigo_venda():
     random_part = "".join(random.choices(string.digits, k=4))
     return f"V-{data_atual}-{random_part}"
 
+_FILTROS_ESPECIAIS_VENDAS = ["data_inicio", "data_fim", "min_total", "max_total",
+                             "min_valor_recebido", "max_valor_recebido", "cliente_id",
+                             "funcionario_id", "produto_nome", "tipo_venda", "dia_semana"]
+
+
+def filtros_vendas_da_requisicao(args):
+    """Parâmetros de filtro da listagem de vendas presentes em `args`."""
+    filtros = {}
+    for key in list(FILTROS_PERMITIDOS_VENDAS.keys()) + ["forma_pagamento"] + _FILTROS_ESPECIAIS_VENDAS:
+        val = (args.get(key) or "").strip()
+        if val:
+            filtros[key] = val
+    return filtros
+
+
+def condicao_busca_vendas(search):
+    """Busca global da listagem: código, observações, cliente e operador."""
+    return or_(
+        ilike_unaccent(Venda.codigo, f"%{search}%"),
+        ilike_unaccent(Venda.observacoes, f"%{search}%"),
+        ilike_unaccent(Cliente.nome, f"%{search}%"),
+        ilike_unaccent(Cliente.cpf, f"%{search}%"),
+        ilike_unaccent(Funcionario.nome, f"%{search}%"),
+    )
+
 def aplicar_filtros_avancados_vendas(query, filtros, estabelecimento_id):
     """Aplica filtros avançados na query de vendas, compatível com múltiplos pagamentos."""
     if estabelecimento_id and str(estabelecimento_id).lower() != 'all':
@@ -123,7 +152,7 @@ def aplicar_filtros_avancados_vendas(query, filtros, estabelecimento_id):
                 data_str = val.strip()
                 eh_dia_puro = len(data_str) <= 10
                 if eh_dia_puro:
-                    campo = func.coalesce(Venda.data_venda, Venda.created_at)
+                    campo = Venda.data_venda
                     if filtro_data == "data_inicio":
                         query = query.filter(campo >= local_date_to_utc_naive(data_str))
                     else:
@@ -135,7 +164,7 @@ def aplicar_filtros_avancados_vendas(query, filtros, estabelecimento_id):
                     except ValueError:
                         pass
                     if data_dt:
-                        campo = func.coalesce(Venda.data_venda, Venda.created_at)
+                        campo = Venda.data_venda
                         if filtro_data == "data_inicio":
                             query = query.filter(campo >= data_dt)
                         else:
@@ -204,29 +233,55 @@ def aplicar_ordenacao_vendas(query, ordenar_por, direcao):
         query = query.order_by(Venda.data_venda.desc())
     return query
 
+def resumo_vendas(ids_select):
+    """Totais das vendas filtradas e dos seus itens numa passada só.
+
+    Os itens entram agregados por venda (LEFT JOIN), então cada venda conta uma
+    vez; o período (min/max de data_venda) sai da mesma consulta."""
+    itens = db.session.query(
+        VendaItem.venda_id.label("venda_id"),
+        func.sum(VendaItem.margem_lucro_real).label("lucro"),
+        func.sum(VendaItem.quantidade).label("quantidade"),
+    ).filter(VendaItem.venda_id.in_(ids_select)).group_by(VendaItem.venda_id).subquery()
+    return db.session.query(
+        func.count(Venda.id).label("quantidade"),
+        func.sum(Venda.total).label("total"),
+        func.sum(Venda.desconto).label("descontos"),
+        func.sum(Venda.valor_recebido).label("valor_recebido"),
+        func.sum(itens.c.lucro).label("lucro"),
+        func.sum(itens.c.quantidade).label("total_itens"),
+        func.min(Venda.data_venda).label("inicio"),
+        func.max(Venda.data_venda).label("fim"),
+    ).select_from(Venda).outerjoin(itens, itens.c.venda_id == Venda.id).filter(Venda.id.in_(ids_select)).first()
+
+
+def ajuste_linear(valores):
+    """Coeficientes (a, b) da reta y = a + b·x por mínimos quadrados, x = 0..n-1."""
+    import numpy as np  # local: numpy fora do boot dos workers (ver relatorios.py)
+
+    if len(valores) < 2:
+        return None
+    b, a = np.polyfit(np.arange(len(valores), dtype=float), np.asarray(valores, dtype=float), 1)
+    return float(a), float(b)
+
+
+def _como_data(valor):
+    """func.date() devolve date no Postgres e texto no SQLite."""
+    return valor if isinstance(valor, date) else datetime.strptime(str(valor), "%Y-%m-%d").date()
+
+
 def calcular_estatisticas_vendas(query_base, estabelecimento_id):
     """Calcula estatísticas agregadas das vendas filtradas usando SQL eficiente."""
     ids_sub = query_base.with_entities(Venda.id).subquery()
     ids_select = db.session.query(ids_sub.c.id)
 
-    resumo = db.session.query(
-        func.count(Venda.id).label('quantidade'),
-        func.sum(Venda.total).label('total'),
-        func.sum(Venda.desconto).label('descontos'),
-        func.sum(Venda.valor_recebido).label('valor_recebido')
-    ).filter(Venda.id.in_(ids_select)).first()
-
-    stats_itens = db.session.query(
-        func.sum(VendaItem.margem_lucro_real).label('lucro'),
-        func.sum(VendaItem.quantidade).label('total_itens')
-    ).filter(VendaItem.venda_id.in_(ids_select)).first()
-
+    resumo = resumo_vendas(ids_select)
     quantidade = resumo.quantidade or 0
     total = float(resumo.total or 0)
-    total_lucro = float(stats_itens.lucro or 0)
+    total_lucro = float(resumo.lucro or 0)
     descontos = float(resumo.descontos or 0)
     valor_recebido = float(resumo.valor_recebido or 0)
-    total_itens = int(stats_itens.total_itens or 0)
+    total_itens = int(resumo.total_itens or 0)
     ticket_medio = total / quantidade if quantidade > 0 else 0
 
     formas = db.session.query(
@@ -255,11 +310,6 @@ def calcular_estatisticas_vendas(query_base, estabelecimento_id):
         formas_dict[norm_key]["quantidade"] += f.quantidade
         formas_dict[norm_key]["total"] += float(f.total or 0)
 
-    datas = query_base.with_entities(
-        func.min(Venda.data_venda).label("inicio"),
-        func.max(Venda.data_venda).label("fim")
-    ).first()
-
     return {
         "total_valor": total,
         "total_vendas": total,
@@ -272,8 +322,8 @@ def calcular_estatisticas_vendas(query_base, estabelecimento_id):
         "total_itens": total_itens,
         "formas_pagamento": formas_dict,
         "periodo": {
-            "data_inicio": datas.inicio.isoformat() if datas and datas.inicio else None,
-            "data_fim": datas.fim.isoformat() if datas and datas.fim else None
+            "data_inicio": resumo.inicio.isoformat() if resumo.inicio else None,
+            "data_fim": resumo.fim.isoformat() if resumo.fim else None
         }
     }
 
@@ -292,30 +342,12 @@ def listar_vendas():
         direcao = request.args.get("direcao", "desc")
         search = request.args.get("search", "").strip()
 
-        filtros = {}
-        for key in list(FILTROS_PERMITIDOS_VENDAS.keys()) + ["forma_pagamento"]:
-            val = request.args.get(key, "").strip()
-            if val:
-                filtros[key] = val
-        for special in ["data_inicio", "data_fim", "min_total", "max_total",
-                        "min_valor_recebido", "max_valor_recebido", "cliente_id",
-                        "funcionario_id", "produto_nome", "tipo_venda", "dia_semana"]:
-            val = request.args.get(special, "").strip()
-            if val:
-                filtros[special] = val
+        filtros = filtros_vendas_da_requisicao(request.args)
 
         query_base = Venda.query
 
         if search:
-            query_base = query_base.filter(
-                or_(
-                    ilike_unaccent(Venda.codigo, f"%{search}%"),
-                    ilike_unaccent(Venda.observacoes, f"%{search}%"),
-                    ilike_unaccent(Cliente.nome, f"%{search}%"),
-                    ilike_unaccent(Cliente.cpf, f"%{search}%"),
-                    ilike_unaccent(Funcionario.nome, f"%{search}%"),
-                )
-            )
+            query_base = query_base.filter(condicao_busca_vendas(search))
 
         query_base = aplicar_filtros_avancados_vendas(query_base, filtros, estabelecimento_id)
 
@@ -392,10 +424,7 @@ def listar_vendas():
                 "total_itens": estatisticas["total_itens"],
                 "formas_pagamento": estatisticas["formas_pagamento"],
             },
-            "filtros_disponiveis": list(FILTROS_PERMITIDOS_VENDAS.keys()) + ["forma_pagamento"] + [
-                "data_inicio", "data_fim", "min_total", "max_total", "min_valor_recebido",
-                "max_valor_recebido", "cliente_id", "funcionario_id", "produto_nome", "tipo_venda", "dia_semana"
-            ],
+            "filtros_disponiveis": list(FILTROS_PERMITIDOS_VENDAS.keys()) + ["forma_pagamento"] + _FILTROS_ESPECIAIS_VENDAS,
             "ordenacoes_disponiveis": list(ORDENACOES_PERMITIDAS.keys()),
         }
 
@@ -421,52 +450,42 @@ def estatisticas_vendas():
         ids_sub = query_base.with_entities(Venda.id).subquery()
         ids_select = db.session.query(ids_sub.c.id)
 
-        stats_gerais = db.session.query(
-            func.count(Venda.id).label("total_vendas_count"),
-            func.sum(Venda.total).label("total_valor")
-        ).filter(Venda.id.in_(ids_select)).first()
-
-        total_vendas_count = stats_gerais.total_vendas_count or 0
-        total_valor = float(stats_gerais.total_valor or 0)
-
-        stats_itens = db.session.query(
-            func.sum(VendaItem.margem_lucro_real).label("total_lucro"),
-            func.sum(VendaItem.quantidade).label("total_itens")
-        ).filter(VendaItem.venda_id.in_(ids_select)).first()
-        total_lucro = float(stats_itens.total_lucro or 0)
-        total_itens_venda = float(stats_itens.total_itens or 0)
+        resumo = resumo_vendas(ids_select)
+        total_vendas_count = resumo.quantidade or 0
+        total_valor = float(resumo.total or 0)
+        total_lucro = float(resumo.lucro or 0)
+        total_itens_venda = float(resumo.total_itens or 0)
 
         ticket_medio = total_valor / total_vendas_count if total_vendas_count > 0 else 0
         itens_por_venda = total_itens_venda / total_vendas_count if total_vendas_count > 0 else 0
 
-        campo_data_dia = func.date(func.coalesce(Venda.data_venda, Venda.created_at))
-        vendas_por_dia_res = db.session.query(
+        # Série por dia e por hora numa passada: GROUP BY (dia, hora) dobrado aqui
+        campo_data_dia = func.date(Venda.data_venda)
+        campo_hora = get_hour_extract(Venda.data_venda)
+        serie = db.session.query(
             campo_data_dia.label("data"),
+            campo_hora.label("hora"),
             func.count(Venda.id).label("quantidade"),
             func.sum(Venda.total).label("total")
-        ).filter(Venda.id.in_(ids_select)).group_by(campo_data_dia).order_by(campo_data_dia.asc()).all()
+        ).filter(Venda.id.in_(ids_select)).group_by(campo_data_dia, campo_hora).all()
+        por_dia = defaultdict(lambda: [0, 0.0])
+        por_hora = defaultdict(lambda: [0, 0.0])
+        for v in serie:
+            for acumulado in (por_dia[_como_data(v.data)], por_hora[int(v.hora or 0)]):
+                acumulado[0] += v.quantidade
+                acumulado[1] += float(v.total or 0)
+        dias = sorted(por_dia)
 
         previsao_vendas = []
-        if len(vendas_por_dia_res) >= 7:
-            valores_y = [float(v.total or 0) for v in vendas_por_dia_res]
-            n = len(valores_y)
-            valores_x = list(range(n))
-            media_x = sum(valores_x) / n
-            media_y = sum(valores_y) / n
-            numerador = sum((valores_x[i] - media_x) * (valores_y[i] - media_y) for i in range(n))
-            denominador = sum((valores_x[i] - media_x) ** 2 for i in range(n))
-            if denominador != 0:
-                b = numerador / denominador
-                a = media_y - b * media_x
-                ultima_data_str = str(vendas_por_dia_res[-1].data)
-                ultima_data = datetime.strptime(ultima_data_str, '%Y-%m-%d').date()
-                for i in range(1, 8):
-                    proxima_data = ultima_data + timedelta(days=i)
-                    x_futuro = n + i - 1
-                    valor_previsto = max(0, a + b * x_futuro)
-                    previsao_vendas.append({"data": proxima_data.isoformat(), "total": round(valor_previsto, 2), "tipo": "previsao"})
-
-        vendas_historicas = [{"data": str(v.data), "quantidade": v.quantidade, "total": float(v.total or 0), "tipo": "historico"} for v in vendas_por_dia_res]
+        ajuste = ajuste_linear([por_dia[d][1] for d in dias]) if len(dias) >= 7 else None
+        if ajuste:
+            a, b = ajuste
+            for i in range(1, 8):
+                valor_previsto = max(0, a + b * (len(dias) + i - 1))
+                previsao_vendas.append({"data": (dias[-1] + timedelta(days=i)).isoformat(),
+                                        "total": round(valor_previsto, 2), "tipo": "previsao"})
+
+        vendas_historicas = [{"data": d.isoformat(), "quantidade": por_dia[d][0], "total": por_dia[d][1], "tipo": "historico"} for d in dias]
 
         from sqlalchemy import case
         formas_pgto_raw = db.session.query(
@@ -506,11 +525,6 @@ def estatisticas_vendas():
             Cliente.nome, func.count(Venda.id), func.sum(Venda.total)
         ).group_by(Cliente.id, Cliente.nome).order_by(func.sum(Venda.total).desc()).limit(10).all()
 
-        campo_hora = get_hour_extract(func.coalesce(Venda.data_venda, Venda.created_at))
-        vendas_hora_res = db.session.query(
-            campo_hora, func.count(Venda.id), func.sum(Venda.total)
-        ).filter(Venda.id.in_(ids_select)).group_by(campo_hora).all()
-
         produtos_res = db.session.query(
             Produto.nome, Fornecedor.nome_fantasia,
             func.sum(VendaItem.quantidade), func.sum(VendaItem.total_item)
@@ -546,7 +560,7 @@ def estatisticas_vendas():
             ],
             "vendas_por_funcionario": [{"funcionario": v[0], "quantidade": v[1], "total": float(v[2] or 0)} for v in vendas_func_res],
             "vendas_por_cliente": [{"cliente": v[0], "quantidade": v[1], "total": float(v[2] or 0)} for v in vendas_cliente_res],
-            "vendas_por_hora": [{"hora": int(v[0] or 0), "quantidade": v[1], "total": float(v[2] or 0)} for v in vendas_hora_res],
+            "vendas_por_hora": [{"hora": h, "quantidade": q, "total": t} for h, (q, t) in sorted(por_hora.items())],
             "produtos_mais_vendidos": [{"nome": p[0], "fornecedor": p[1] or "Sem Fornecedor", "quantidade": p[2], "total": float(p[3] or 0)} for p in produtos_res],
             "vendas_por_fornecedor": [{"fornecedor": f[0], "quantidade_vendas": f[1], "total": float(f[2] or 0)} for f in fornecedores_res],
         }), 200
@@ -575,17 +589,25 @@ def relatorio_diario():
 
         query = Venda.query.filter(
             Venda.status == "finalizada",
-            func.coalesce(Venda.data_venda, Venda.created_at) >= inicio_dia,
-            func.coalesce(Venda.data_venda, Venda.created_at) <= fim_dia
+            Venda.data_venda >= inicio_dia,
+            Venda.data_venda <= fim_dia
         )
         if estabelecimento_id and str(estabelecimento_id).lower() != 'all':
             query = query.filter(Venda.estabelecimento_id == estabelecimento_id)
         vendas = query.options(
-            db.joinedload(Venda.itens),
             db.joinedload(Venda.funcionario),
             db.joinedload(Venda.cliente),
             db.selectinload(Venda.pagamentos),
-        ).order_by(Venda.created_at.desc()).all()
+        ).order_by(Venda.data_venda.desc()).all()
+
+        # Itens do dia agregados por (venda, produto) no banco, sem carregar VendaItem
+        ids_sub = query.with_entities(Venda.id).subquery()
+        itens_dia = db.session.query(
+            VendaItem.venda_id, VendaItem.produto_id, func.max(VendaItem.produto_nome),
+            func.count(VendaItem.id), func.sum(VendaItem.quantidade), func.sum(VendaItem.total_item)
+        ).filter(VendaItem.venda_id.in_(db.session.query(ids_sub.c.id))).group_by(
+            VendaItem.venda_id, VendaItem.produto_id
+        ).all()
 
         total_vendas = sum(v.total for v in vendas)
         total_descontos = sum(v.desconto for v in vendas)
@@ -596,7 +618,7 @@ def relatorio_diario():
         for v in vendas:
             for p in v.pagamentos:
                 if p.status == "aprovado":
-                    nk = _norm(p.forma_pagamento)
+                    nk = _norm_forma_pagamento(p.forma_pagamento)
                     formas_pagamento[nk]["quantidade"] += 1
                     formas_pagamento[nk]["total"] += float(p.valor)
 
@@ -609,15 +631,16 @@ def relatorio_diario():
                 funcionarios[func_id]["nome"] = v.funcionario.nome
 
         produtos_dia = defaultdict(lambda: {"quantidade": 0, "total": 0, "nome": ""})
-        for v in vendas:
-            for item in v.itens:
-                produtos_dia[item.produto_id]["quantidade"] += float(item.quantidade)
-                produtos_dia[item.produto_id]["total"] += float(item.total_item)
-                produtos_dia[item.produto_id]["nome"] = item.produto_nome
+        itens_por_venda = defaultdict(int)
+        for venda_id, produto_id, nome, linhas, quantidade, total_item in itens_dia:
+            produtos_dia[produto_id]["quantidade"] += float(quantidade or 0)
+            produtos_dia[produto_id]["total"] += float(total_item or 0)
+            produtos_dia[produto_id]["nome"] = nome
+            itens_por_venda[venda_id] += linhas
 
         vendas_por_hora = defaultdict(lambda: {"quantidade": 0, "total": 0})
         for v in vendas:
-            hora = v.created_at.hour
+            hora = v.data_venda.hour
             vendas_por_hora[hora]["quantidade"] += 1
             vendas_por_hora[hora]["total"] += float(v.total)
 
@@ -651,8 +674,8 @@ def relatorio_diario():
                         "funcionario": v.funcionario.nome if v.funcionario else "Não Informado",
                         "total": float(v.total),
                         "forma_pagamento": (v.pagamentos[0].forma_pagamento if v.pagamentos else "N/A"),
-                        "hora": v.created_at.strftime("%H:%M"),
-                        "quantidade_itens": len(v.itens),
+                        "hora": v.data_venda.strftime("%H:%M"),
+                        "quantidade_itens": itens_por_venda[v.id],
                     }
                     for v in vendas
                 ],
@@ -676,58 +699,52 @@ def analise_tendencia():
         data_fim = datetime.now()
         data_inicio = data_fim - timedelta(days=30 * meses)
 
-        query = Venda.query.filter(
+        # Uma agregação por dia (índice estabelecimento/data_venda/status); semanas e
+        # meses são janelas de 7/30 dias contadas de hoje, dobradas aqui.
+        campo_dia = func.date(Venda.data_venda)
+        por_dia = db.session.query(
+            campo_dia.label("data"),
+            func.count(Venda.id).label("quantidade"),
+            func.sum(Venda.total).label("total"),
+        ).filter(
             Venda.estabelecimento_id == estabelecimento_id,
             Venda.status == "finalizada",
-            Venda.created_at >= data_inicio,
-            Venda.created_at <= data_fim,
-        )
+        ).group_by(campo_dia)
 
         resultados = []
 
         if periodo == "diario":
-            vendas_por_dia = db.session.query(
-                func.date(Venda.created_at).label("data"),
-                func.count(Venda.id).label("quantidade"),
-                func.sum(Venda.total).label("total"),
-            ).filter(
-                Venda.estabelecimento_id == estabelecimento_id,
-                Venda.status == "finalizada"
-            ).group_by(func.date(Venda.created_at)).order_by(func.date(Venda.created_at).desc()).limit(30).all()
-            for vpd in vendas_por_dia:
+            for vpd in por_dia.order_by(campo_dia.desc()).limit(30).all():
                 resultados.append({
-                    "periodo": vpd.data.strftime("%d/%m/%Y"),
+                    "periodo": _como_data(vpd.data).strftime("%d/%m/%Y"),
                     "quantidade": vpd.quantidade,
                     "total": float(vpd.total) if vpd.total else 0,
                 })
-        elif periodo == "semanal":
-            for i in range(meses * 4):
-                semana_fim = data_fim - timedelta(weeks=i)
-                semana_inicio = semana_fim - timedelta(weeks=1)
-                vendas_semana = query.filter(
-                    Venda.created_at >= semana_inicio,
-                    Venda.created_at <= semana_fim,
-                ).all()
-                resultados.append({
-                    "periodo": f"Semana {i+1} ({semana_inicio.strftime('%d/%m')} - {semana_fim.strftime('%d/%m')})",
-                    "quantidade": len(vendas_semana),
-                    "total": sum(v.total for v in vendas_semana),
-                })
         else:
-            for i in range(meses):
-                mes_fim = data_fim - timedelta(days=30 * i)
-                mes_inicio = mes_fim - timedelta(days=30)
-                vendas_mes = query.filter(
-                    Venda.created_at >= mes_inicio,
-                    Venda.created_at <= mes_fim,
-                ).all()
-                total_mes = sum(v.total for v in vendas_mes)
-                resultados.append({
-                    "periodo": mes_inicio.strftime("%B %Y"),
-                    "quantidade": len(vendas_mes),
-                    "total": total_mes,
-                    "ticket_medio": total_mes / len(vendas_mes) if vendas_mes else 0,
-                })
+            dias = por_dia.filter(Venda.data_venda >= data_inicio, Venda.data_venda <= data_fim).all()
+            tamanho, janelas = (7, meses * 4) if periodo == "semanal" else (30, meses)
+            baldes = [[0, 0.0] for _ in range(janelas)]
+            for vpd in dias:
+                i = (data_fim.date() - _como_data(vpd.data)).days // tamanho
+                if 0 <= i < janelas:
+                    baldes[i][0] += vpd.quantidade
+                    baldes[i][1] += float(vpd.total or 0)
+            for i, (quantidade, total) in enumerate(baldes):
+                fim_janela = data_fim - timedelta(days=tamanho * i)
+                inicio_janela = fim_janela - timedelta(days=tamanho)
+                if periodo == "semanal":
+                    resultados.append({
+                        "periodo": f"Semana {i+1} ({inicio_janela.strftime('%d/%m')} - {fim_janela.strftime('%d/%m')})",
+                        "quantidade": quantidade,
+                        "total": total,
+                    })
+                else:
+                    resultados.append({
+                        "periodo": inicio_janela.strftime("%B %Y"),
+                        "quantidade": quantidade,
+                        "total": total,
+                        "ticket_medio": total / quantidade if quantidade else 0,
+                    })
 
         if len(resultados) > 1:
             for i in range(len(resultados) - 1):
@@ -736,9 +753,17 @@ def analise_tendencia():
                 crescimento = ((atual - anterior) / anterior * 100) if anterior > 0 else (100 if atual > 0 else 0)
                 resultados[i]["crescimento"] = round(crescimento, 2)
 
+        tendencia = None
+        ajuste = ajuste_linear([r["total"] for r in reversed(resultados)])
+        if ajuste:
+            inclinacao = round(ajuste[1], 2)
+            tendencia = {"inclinacao": inclinacao,
+                         "direcao": "alta" if inclinacao > 0 else "queda" if inclinacao < 0 else "estavel"}
+
         return jsonify({
             "periodo_analisado": periodo,
             "meses_analisados": meses,
+            "tendencia": tendencia,
             "data_inicio": data_inicio.strftime("%Y-%m-%d"),
             "data_fim": data_fim.strftime("%Y-%m-%d"),
             "resultados": resultados,
@@ -774,6 +799,10 @@ def criar_venda():
         data = request.get_json()
         if not data or not data.get("items"):
             return jsonify({"error": "Dados inválidos ou carrinho vazio"}), 400
+        try:
+            produto_ids = VendaService.ids_de_produto(data["items"])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         try:
             subtotal = float(data.get("subtotal", 0))
@@ -862,17 +891,16 @@ def criar_venda():
             db.session.add(nova_venda)
             db.session.flush()
 
-            for item_data in data["items"]:
+            # Lock pessimista para consistência ACID em concorrência: todos os
+            # produtos numa consulta, em ordem de id (mesma ordem do cancelamento)
+            produtos_travados = VendaService.travar_produtos(nova_venda.estabelecimento_id, produto_ids)
+
+            for item_data, produto_id in zip(data["items"], produto_ids):
                 # Extração robusta de campos (suporte a múltiplos padrões de frontend)
-                produto_id = item_data.get("id") or item_data.get("productId") or item_data.get("produto_id")
                 quantidade = float(item_data.get("quantity") or item_data.get("quantidade", 1))
                 preco_unitario = float(item_data.get("price") or item_data.get("preco_unitario", 0))
 
-                if not produto_id:
-                    raise Exception("ID do produto não informado no item")
-                
-                # Lock pessimista para consistência ACID em concorrência
-                produto = Produto.query.filter_by(id=produto_id, estabelecimento_id=nova_venda.estabelecimento_id).with_for_update().first()
+                produto = produtos_travados.get(produto_id)
                 if not produto:
                     raise Exception(f"Produto {produto_id} não encontrado neste estabelecimento")
                 
@@ -1169,7 +1197,7 @@ def cancelar_venda(venda_id):
         query = Venda.query.filter_by(id=venda_id)
         if str(estabelecimento_id).lower() != 'all':
             query = query.filter_by(estabelecimento_id=estabelecimento_id)
-        venda = query.options(db.joinedload(Venda.itens)).first_or_404()
+        venda = query.first_or_404()
         if venda.status == "cancelada":
             return jsonify({"error": "Esta venda já está cancelada"}), 400
 
@@ -1183,13 +1211,15 @@ def cancelar_venda(venda_id):
 
         autorizador = None
         if pin_cancelamento:
-            # Localiza o admin/gerente do tenant cujo PIN confere (comparação por hash)
-            candidatos = Funcionario.query.filter(
-                Funcionario.estabelecimento_id == estabelecimento_id,
-                Funcionario.pin_cancelamento.isnot(None),
-                Funcionario.nivel_acesso <= 2,
-            ).all()
-            autorizador = next((f for f in candidatos if f.check_pin(pin_cancelamento)), None)
+            # Localiza o admin/gerente do tenant pela chave indexada do PIN (um único hash)
+            from app.services.pin_service import PinBloqueado, PinService, origem_da_requisicao
+            try:
+                autorizador = PinService.autorizar(venda.estabelecimento_id, pin_cancelamento,
+                                                   origem=origem_da_requisicao(venda.estabelecimento_id, venda.caixa_id))
+            except PinBloqueado as e:
+                resp = jsonify({"error": str(e), "retry_after": e.retry_after})
+                resp.headers["Retry-After"] = str(e.retry_after)
+                return resp, 429
             if not autorizador:
                 return jsonify({"error": "PIN inválido ou sem permissão para cancelar"}), 403
         elif senha_admin:
@@ -1214,81 +1244,14 @@ def cancelar_venda(venda_id):
 
         db.session.begin_nested()
         try:
-            for item in venda.itens:
-                produto = Produto.query.filter_by(id=item.produto_id, estabelecimento_id=estabelecimento_id).first()
-                if produto:
-                    qtd_anterior = float(produto.quantidade or 0)
-                    produto.quantidade = qtd_anterior + float(item.quantidade)
-                    # Reverter denormalizações do produto — sem isso, giro/curva
-                    # ABC/ranking de mais vendidos ficavam inflados por vendas
-                    # que na verdade foram desfeitas.
-                    produto.quantidade_vendida = max(
-                        0.0, float(produto.quantidade_vendida or 0) - float(item.quantidade)
-                    )
-                    produto.total_vendido = max(
-                        0.0, float(produto.total_vendido or 0) - float(item.total_item or 0)
-                    )
-                    mov = MovimentacaoEstoque(
-                        estabelecimento_id=estabelecimento_id,
-                        produto_id=item.produto_id,
-                        tipo="entrada",
-                        quantidade=float(item.quantidade),
-                        quantidade_anterior=qtd_anterior,
-                        quantidade_atual=float(produto.quantidade),
-                        motivo=f"Cancelamento da venda #{venda.codigo}",
-                        observacoes=f"Devolução por cancelamento. Motivo: {motivo}",
-                        venda_id=venda.id,
-                        funcionario_id=funcionario_id,
-                    )
-                    db.session.add(mov)
-
-            # Reverter denormalizações do CLIENTE — sem isso, "melhor cliente"
-            # e o histórico de gasto ficavam inflados com vendas desfeitas
-            # (bug real detectado: valor_total_gasto > soma das vendas finalizadas).
-            cliente = None
-            if venda.cliente_id:
-                cliente = Cliente.query.filter_by(
-                    id=venda.cliente_id, estabelecimento_id=estabelecimento_id
-                ).first()
-                if cliente:
-                    cliente.valor_total_gasto = max(
-                        0, float(cliente.valor_total_gasto or 0) - float(venda.total or 0)
-                    )
-                    cliente.total_compras = max(0, int(cliente.total_compras or 0) - 1)
-
-            # Estornar pagamentos e reverter fiado em aberto vinculado a esta venda
-            for pag in Pagamento.query.filter_by(venda_id=venda.id).all():
-                pag.status = "estornado"
-
-            conta = ContaReceber.query.filter_by(venda_id=venda.id, status="aberto").first()
-            if conta:
-                conta.status = "cancelado"
-                if cliente:
-                    cliente.saldo_devedor = max(
-                        0, float(cliente.saldo_devedor or 0) - float(conta.valor_atual or 0)
-                    )
-
-            venda.status = "cancelada"
-            agora = datetime.now()
-            venda.data_cancelamento = agora
-            venda.motivo_cancelamento = (motivo or "")[:255]
-            autorizado_por = f" | Autorizado por: {autorizador.nome}" if autorizador else ""
-            venda.observacoes = f"{venda.observacoes or ''}\n[Cancelada em {agora.strftime('%d/%m/%Y %H:%M')}] Motivo: {motivo}{autorizado_por}".strip()
-            venda.updated_at = agora
-
-            from app.models import Auditoria
-            Auditoria.registrar(
-                estabelecimento_id=estabelecimento_id,
-                tipo_evento="venda_cancelada",
-                descricao=f"Venda {venda.codigo} cancelada — {motivo}" + (
-                    f" (autorizado por {autorizador.nome})" if autorizador else ""
-                ),
-                usuario_id=autorizador.id if autorizador else funcionario_id,
-                valor=float(venda.total or 0),
-            )
-
+            # Estoque, lotes, pagamentos, fiado e cliente revertidos em lote,
+            # com a mesma disciplina de travas do checkout (VendaService).
+            revertido = VendaService.cancelar(venda, motivo, funcionario_id, autorizador)
             db.session.commit()
-            return jsonify({"success": True, "message": "Venda cancelada com sucesso"}), 200
+            return jsonify({"success": True, "message": "Venda cancelada com sucesso", "revertido": revertido}), 200
+        except VendaJaCanceladaError as e:
+            db.session.rollback()
+            return jsonify({"error": e.message}), e.status_code
         except Exception as e:
             db.session.rollback()
             return jsonify({"error": f"Erro ao processar cancelamento: {str(e)}"}), 500
@@ -1296,53 +1259,60 @@ def cancelar_venda(venda_id):
         return jsonify({"error": f"Erro ao cancelar venda: {str(e)}"}), 500
 
 
+@registrar_exportacao("vendas")
+def exportacao_vendas(estabelecimento_id, args):
+    """Vendas com os filtros/ordenação da listagem; pagamentos e itens entram
+    como subconsultas correlatas (nada de carregar a venda inteira)."""
+    filtros = filtros_vendas_da_requisicao(args)
+    formas = (select(get_string_agg(Pagamento.forma_pagamento, ", "))
+              .where(Pagamento.venda_id == Venda.id).correlate(Venda).scalar_subquery())
+    itens = (select(func.count(VendaItem.id))
+             .where(VendaItem.venda_id == Venda.id).correlate(Venda).scalar_subquery())
+    consulta = (
+        select(Venda.codigo, Venda.data_venda, Venda.subtotal, Venda.desconto, Venda.total, Venda.status,
+               Cliente.nome.label("cliente_nome"), Funcionario.nome.label("funcionario_nome"),
+               formas.label("formas"), itens.label("itens"))
+        .select_from(Venda)
+        .outerjoin(Cliente, Cliente.id == Venda.cliente_id)
+        .outerjoin(Funcionario, Funcionario.id == Venda.funcionario_id)
+        .where(Venda.deleted_at.is_(None))
+    )
+    search = (args.get("search") or "").strip()
+    if search:
+        consulta = consulta.filter(condicao_busca_vendas(search))
+    consulta = aplicar_filtros_avancados_vendas(consulta, filtros, estabelecimento_id)
+    if filtros.get("produto_nome"):
+        consulta = consulta.distinct()  # o join com itens repetiria a venda
+    consulta = aplicar_ordenacao_vendas(consulta, args.get("ordenar_por", "data"), args.get("direcao", "desc"))
+    return Exportacao("vendas", consulta, [
+        Coluna("Código", "codigo"),
+        Coluna("Data", lambda v: v.data_venda.strftime("%d/%m/%Y %H:%M") if v.data_venda else ""),
+        Coluna("Cliente", "cliente_nome"),
+        Coluna("Funcionário", "funcionario_nome"),
+        Coluna("Subtotal", lambda v: f"{float(v.subtotal or 0):.2f}"),
+        Coluna("Desconto", lambda v: f"{float(v.desconto or 0):.2f}"),
+        Coluna("Total", lambda v: f"{float(v.total or 0):.2f}"),
+        Coluna("Forma Pagamento", lambda v: v.formas or "N/A"),
+        Coluna("Status", "status"),
+        Coluna("Itens", "itens"),
+    ], bom=True)
+
+
 @vendas_bp.route("/exportar", methods=["GET"], strict_slashes=False)
 @jwt_required()
 def exportar_vendas():
+    """Exporta as vendas filtradas como na listagem: CSV em stream (com BOM,
+    abre direto no Excel) ou ?formato=excel (.xlsx). ?assincrono=true gera o
+    arquivo em background."""
     try:
         estabelecimento_id = get_authorized_establishment_id()
-        data_inicio = request.args.get("data_inicio")
-        data_fim = request.args.get("data_fim")
-        status = request.args.get("status")
         formato = request.args.get("formato", "csv")
-
-        query = Venda.query.filter(Venda.estabelecimento_id == estabelecimento_id)
-        if data_inicio:
-            query = query.filter(Venda.data_venda >= datetime.strptime(data_inicio, "%Y-%m-%d"))
-        if data_fim:
-            query = query.filter(Venda.data_venda <= datetime.strptime(data_fim, "%Y-%m-%d") + timedelta(days=1))
-        if status:
-            query = query.filter(Venda.status == status)
-
-        vendas = query.options(db.selectinload(Venda.pagamentos)).order_by(Venda.data_venda.desc()).limit(5000).all()
-
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter=";")
-        writer.writerow(["Código", "Data", "Cliente", "Funcionário", "Subtotal", "Desconto", "Total", "Forma Pagamento", "Status", "Itens"])
-        for v in vendas:
-            cliente_nome = v.cliente.nome if v.cliente else ""
-            func_nome = v.funcionario.nome if v.funcionario else ""
-            formas = ", ".join(p.forma_pagamento for p in v.pagamentos) if v.pagamentos else "N/A"
-            writer.writerow([
-                v.codigo,
-                v.data_venda.strftime("%d/%m/%Y %H:%M") if v.data_venda else "",
-                cliente_nome,
-                func_nome,
-                f"{float(v.subtotal):.2f}",
-                f"{float(v.desconto):.2f}",
-                f"{float(v.total):.2f}",
-                formas,
-                v.status,
-                len(v.itens)
-            ])
-        content = output.getvalue()
-        output.close()
-
-        mimetype = "application/vnd.ms-excel" if formato == "excel" else "text/csv"
-        ext = "xls" if formato == "excel" else "csv"
-        resp = Response("\ufeff" + content, mimetype=f"{mimetype}; charset=utf-8")
-        resp.headers["Content-Disposition"] = f'attachment; filename="vendas-{datetime.now().strftime("%Y%m%d")}.{ext}"'
-        return resp
+        formato = "xlsx" if formato == "excel" else formato
+        return responder("vendas", estabelecimento_id, request.args, formato,
+                         f'vendas-{datetime.now().strftime("%Y%m%d")}.{formato}',
+                         funcionario_id=get_jwt().get("sub"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"❌ Erro ao exportar vendas: {str(e)}")
         return jsonify({"error": f"Erro ao exportar: {str(e)}"}), 500
@@ -1413,75 +1383,59 @@ def iniciar_venda_pdv():
         cliente_id = data.get("cliente_id")
         if not funcionario_id:
             return jsonify({"error": "Funcionário é obrigatório"}), 400
-        codigo_temp = f"PDV-{datetime.now().strftime('%H%M%S')}-{funcionario_id}"
-        venda = Venda(
-            estabelecimento_id=estabelecimento_id,
-            codigo=codigo_temp,
-            cliente_id=cliente_id,
-            funcionario_id=funcionario_id,
-            subtotal=0,
-            desconto=0,
-            total=0,
-            valor_recebido=0,
-            troco=0,
-            status="em_andamento",
-            quantidade_itens=0
-        )
-        db.session.add(venda)
+        carrinho = CarrinhoService.abrir(estabelecimento_id, funcionario_id, cliente_id)
         db.session.commit()
-        return jsonify({"success": True, "venda_id": venda.id, "codigo_temp": codigo_temp}), 201
+        return jsonify({
+            "success": True,
+            "venda_id": carrinho.venda_id,
+            "codigo_temp": carrinho.codigo_temp,
+            "versao": carrinho.versao,
+        }), 201
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"❌ Erro ao iniciar venda PDV: {str(e)}")
         return jsonify({"error": f"Erro ao iniciar venda: {str(e)}"}), 500
 
 
+def _operar_carrinho(venda_id, operacoes, versao=None, mensagem=None):
+    """Aplica o lote no carrinho quente e responde no formato das rotas do PDV."""
+    carrinho = CarrinhoService.obter(get_authorized_establishment_id(), venda_id)
+    if carrinho is None:
+        return jsonify({"error": "Venda não encontrada"}), 404
+    try:
+        CarrinhoService.aplicar(carrinho, operacoes, versao_esperada=versao)
+    except CarrinhoConflito as e:
+        db.session.rollback()
+        return jsonify({"error": str(e), "carrinho": CarrinhoService.serializar(e.carrinho)}), 409
+    except CarrinhoErro as e:
+        db.session.rollback()
+        return jsonify({"error": e.mensagem}), e.status_code
+    db.session.commit()
+    resposta = {
+        "success": True,
+        "versao": carrinho.versao,
+        "subtotal": float(carrinho.subtotal),
+        "total": float(carrinho.total),
+        "quantidade_itens": int(carrinho.quantidade_itens or 0),
+        "itens": carrinho.itens_json,
+    }
+    if mensagem:
+        resposta["message"] = mensagem
+    return jsonify(resposta), 200
+
+
 @vendas_bp.route("/pdv/<int:venda_id>/adicionar-item", methods=["POST"])
 @jwt_required()
 def adicionar_item_pdv(venda_id):
+    """Adiciona um produto ou, com ``itens``, o lote bipado de uma vez."""
     try:
-        estabelecimento_id = get_authorized_establishment_id()
-        data = request.get_json()
-        produto_id = data.get("produto_id")
-        quantidade = data.get("quantidade", 1)
-        if not produto_id:
+        data = request.get_json() or {}
+        itens = data.get("itens") or ([data] if data.get("produto_id") else [])
+        if not itens or any(not i.get("produto_id") for i in itens):
             return jsonify({"error": "Produto é obrigatório"}), 400
-        query = Venda.query.filter_by(id=venda_id, status="em_andamento")
-        if str(estabelecimento_id).lower() != 'all':
-            query = query.filter_by(estabelecimento_id=estabelecimento_id)
-        venda = query.first_or_404()
-        produto = Produto.query.filter_by(id=produto_id, estabelecimento_id=estabelecimento_id).first_or_404()
-        if float(produto.quantidade or 0) < quantidade:
-            return jsonify({"error": f"Estoque insuficiente. Disponível: {produto.quantidade}"}), 400
-        item = VendaItem.query.filter_by(venda_id=venda_id, produto_id=produto_id).first()
-        if item:
-            item.quantidade = float(item.quantidade) + quantidade
-            item.total_item = float(item.quantidade) * float(item.preco_unitario)
-        else:
-            item = VendaItem(
-                venda_id=venda_id,
-                estabelecimento_id=estabelecimento_id, # Variável local garantida
-                produto_id=produto_id,
-                produto_nome=produto.nome,
-                produto_codigo=produto.codigo_barras,
-                produto_unidade=produto.unidade_medida,
-                quantidade=quantidade,
-                preco_unitario=float(produto.preco_venda),
-                total_item=quantidade * float(produto.preco_venda),
-                desconto=0
-            )
-            db.session.add(item)
-        venda.itens = VendaItem.query.filter_by(venda_id=venda_id).all()
-        venda.subtotal = sum(float(i.preco_unitario) * float(i.quantidade) for i in venda.itens)
-        venda.total = venda.subtotal - float(venda.desconto or 0)
-        venda.quantidade_itens = sum(float(i.quantidade) for i in venda.itens)
-        db.session.commit()
-        return jsonify({
-            "success": True,
-            "subtotal": float(venda.subtotal),
-            "total": float(venda.total),
-            "quantidade_itens": int(venda.quantidade_itens)
-        }), 200
+        operacoes = [{"tipo": "adicionar", "produto_id": i["produto_id"], "quantidade": i.get("quantidade", 1)}
+                     for i in itens]
+        return _operar_carrinho(venda_id, operacoes, data.get("versao"))
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"❌ Erro ao adicionar item: {str(e)}")
@@ -1491,30 +1445,22 @@ def adicionar_item_pdv(venda_id):
 @vendas_bp.route("/pdv/<int:venda_id>/remover-item/<int:item_id>", methods=["DELETE"])
 @jwt_required()
 def remover_item_pdv(venda_id, item_id):
+    """Remove pelo id do VendaItem (checkpoint). O carrinho quente usa remover-produto."""
     try:
-        estabelecimento_id = get_authorized_establishment_id()
-        item = VendaItem.query.join(Venda).filter(
-            VendaItem.id == item_id,
-            VendaItem.venda_id == venda_id,
-            Venda.estabelecimento_id == estabelecimento_id
-        ).first()
-        if not item:
-            return jsonify({"error": "Item não encontrado"}), 404
-        db.session.delete(item)
-        venda = Venda.query.filter_by(id=venda_id, estabelecimento_id=estabelecimento_id).first()
-        if not venda:
-            return jsonify({"error": "Venda não encontrada"}), 404
-        venda.itens = VendaItem.query.filter_by(venda_id=venda_id).all()
-        venda.subtotal = sum(float(i.preco_unitario) * float(i.quantidade) for i in venda.itens)
-        venda.total = venda.subtotal - float(venda.desconto or 0)
-        venda.quantidade_itens = sum(float(i.quantidade) for i in venda.itens)
-        db.session.commit()
-        return jsonify({
-            "success": True,
-            "message": "Item removido do carrinho",
-            "subtotal": float(venda.subtotal),
-            "total": float(venda.total)
-        }), 200
+        return _operar_carrinho(venda_id, [{"tipo": "remover", "item_id": item_id}],
+                                request.args.get("versao", type=int), mensagem="Item removido do carrinho")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"❌ Erro ao remover item: {str(e)}")
+        return jsonify({"error": f"Erro ao remover item: {str(e)}"}), 500
+
+
+@vendas_bp.route("/pdv/<int:venda_id>/remover-produto/<int:produto_id>", methods=["DELETE"])
+@jwt_required()
+def remover_produto_pdv(venda_id, produto_id):
+    try:
+        return _operar_carrinho(venda_id, [{"tipo": "remover", "produto_id": produto_id}],
+                                request.args.get("versao", type=int), mensagem="Item removido do carrinho")
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"❌ Erro ao remover item: {str(e)}")
@@ -1525,46 +1471,48 @@ def remover_item_pdv(venda_id, item_id):
 @jwt_required()
 def atualizar_quantidade_pdv(venda_id):
     try:
-        estabelecimento_id = get_authorized_establishment_id()
-        data = request.get_json()
-        item_id = data.get("item_id")
-        nova_quantidade = data.get("quantidade", 1)
-        if nova_quantidade <= 0:
-            return jsonify({"error": "Quantidade deve ser maior que 0"}), 400
-        item = VendaItem.query.join(Venda).filter(
-            VendaItem.id == item_id,
-            VendaItem.venda_id == venda_id,
-            Venda.estabelecimento_id == estabelecimento_id
-        ).first()
-        if not item:
-            return jsonify({"error": "Item não encontrado"}), 404
-        produto = Produto.query.filter_by(id=item.produto_id, estabelecimento_id=estabelecimento_id).first()
-        if not produto:
-            return jsonify({"error": "Produto não encontrado"}), 404
-        if float(produto.quantidade or 0) < nova_quantidade:
-            return jsonify({"error": f"Estoque insuficiente. Disponível: {produto.quantidade}"}), 400
-        item.quantidade = nova_quantidade
-        item.total_item = nova_quantidade * float(item.preco_unitario)
-        venda = Venda.query.filter_by(id=venda_id, estabelecimento_id=estabelecimento_id).first()
-        if not venda:
-            return jsonify({"error": "Venda não encontrada"}), 404
-        venda.itens = VendaItem.query.filter_by(venda_id=venda_id).all()
-        venda.subtotal = sum(float(i.preco_unitario) * float(i.quantidade) for i in venda.itens)
-        venda.total = venda.subtotal - float(venda.desconto or 0)
-        venda.quantidade_itens = sum(float(i.quantidade) for i in venda.itens)
-        db.session.commit()
-        return jsonify({
-            "success": True,
-            "subtotal": float(venda.subtotal),
-            "total": float(venda.total),
-            "quantidade_itens": int(venda.quantidade_itens)
-        }), 200
+        data = request.get_json() or {}
+        operacao = {"tipo": "quantidade", "quantidade": data.get("quantidade", 1)}
+        if data.get("produto_id"):
+            operacao["produto_id"] = data["produto_id"]
+        else:
+            operacao["item_id"] = data.get("item_id")
+        return _operar_carrinho(venda_id, [operacao], data.get("versao"))
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"❌ Erro ao atualizar quantidade: {str(e)}")
         return jsonify({"error": f"Erro ao atualizar quantidade: {str(e)}"}), 500
 
 
+@vendas_bp.route("/pdv/<int:venda_id>/operacoes", methods=["POST"])
+@jwt_required()
+def operar_carrinho_pdv(venda_id):
+    """Lote misto: {"versao": n, "operacoes": [{"tipo": "adicionar|quantidade|remover", "produto_id", "quantidade"}]}."""
+    try:
+        data = request.get_json() or {}
+        return _operar_carrinho(venda_id, data.get("operacoes") or [], data.get("versao"))
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"❌ Erro ao operar carrinho: {str(e)}")
+        return jsonify({"error": f"Erro ao operar carrinho: {str(e)}"}), 500
+
+
+@vendas_bp.route("/pdv/<int:venda_id>/carrinho", methods=["GET"])
+@jwt_required()
+def obter_carrinho_pdv(venda_id):
+    """Estado completo do carrinho (retomada do terminal após queda)."""
+    try:
+        carrinho = CarrinhoService.obter(get_authorized_establishment_id(), venda_id)
+        if carrinho is None:
+            return jsonify({"error": "Venda não encontrada"}), 404
+        db.session.commit()
+        return jsonify({"success": True, "carrinho": CarrinhoService.serializar(carrinho)}), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"❌ Erro ao obter carrinho: {str(e)}")
+        return jsonify({"error": f"Erro ao obter carrinho: {str(e)}"}), 500
+
+
 @vendas_bp.route("/pdv/configuracoes", methods=["GET"])
 @jwt_required()
 def obter_configuracoes_pdv():
@@ -1616,25 +1564,25 @@ def calcular_troco():
 def listar_carrinhos_ativos():
     try:
         estabelecimento_id = get_authorized_establishment_id()
-        vendas_ativas = Venda.query.filter(
-            Venda.status == "em_andamento",
-            Venda.estabelecimento_id == estabelecimento_id
-        ).all()
+        carrinhos = CarrinhoService.recuperar(estabelecimento_id, request.args.get("funcionario_id", type=int))
+        db.session.commit()
         return jsonify({
             "carrinhos_ativos": [
                 {
-                    "venda_id": v.id,
-                    "codigo_temp": v.codigo,
-                    "funcionario_id": v.funcionario_id,
-                    "cliente_id": v.cliente_id,
-                    "total": float(v.total),
-                    "quantidade_itens": int(v.quantidade_itens or 0),
-                    "iniciada_em": v.created_at.isoformat()
+                    "venda_id": c.venda_id,
+                    "codigo_temp": c.codigo_temp,
+                    "funcionario_id": c.funcionario_id,
+                    "cliente_id": c.cliente_id,
+                    "versao": c.versao,
+                    "total": float(c.total),
+                    "quantidade_itens": int(c.quantidade_itens or 0),
+                    "iniciada_em": c.criado_em.isoformat()
                 }
-                for v in vendas_ativas
+                for c in carrinhos
             ]
         }), 200
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"❌ Erro ao listar carrinhos ativos: {str(e)}")
         return jsonify({"error": f"Erro ao listar carrinhos ativos: {str(e)}"}), 500
 
@@ -3,9 +3,13 @@
 Endpoints do Motor de Renderização Contextual.
 
 O frontend consome GET /api/view-schema/ e renderiza campos, unidades e KPIs a
-partir do schema resolvido (Global → Tenant). Os PUTs gravam o nível Tenant da
+partir do schema resolvido (Global → Tenant). A resposta sai do artefato
+compilado, com ETag: o navegador revalida e recebe 304 se nada mudou. Os PUTs gravam o nível Tenant da
 cascata: segmento do estabelecimento e overrides de exibição.
 """
+import hashlib
+import json
+
 from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt
 
@@ -13,6 +17,7 @@ from app import db
 from app.models import Estabelecimento
 from app.services.view_schema_service import (
     SEGMENTOS,
+    compilar_view_schema,
     invalidar_cache_view_schema,
     mix_permitido_para_estabelecimento,
     resolver_view_schema,
@@ -47,14 +52,23 @@ def obter_view_schema():
     Com ?base=1 devolve o nível Global puro do segmento (sem overrides) junto com
     os overrides salvos — é o que a tela de configurações usa para religar campos.
     """
-    def _sem_cache(payload, status=200):
+    def _responder(artefato, overrides=None):
         # O schema depende de tenant + família + overrides em tempo real — o
-        # navegador nunca pode servir uma resposta antiga do próprio cache HTTP
+        # navegador nunca pode servir uma resposta antiga sem perguntar
         # (aconteceu de verdade: trocar de família repetia a mesma URL GET e o
         # Chrome devolvia a resposta anterior sem nem chamar o backend de novo).
-        resp = jsonify(payload)
-        resp.headers["Cache-Control"] = "no-store, must-revalidate"
-        return resp, status
+        # no-cache obriga a revalidar; com o ETag do artefato, o que não mudou
+        # volta como 304 sem corpo. O JSON já vem serializado do artefato.
+        corpo = '{"success":true,"schema":' + artefato.json
+        etag = artefato.etag
+        if overrides is not None:
+            extra = json.dumps(overrides, ensure_ascii=False, sort_keys=True)
+            corpo += ',"overrides":' + extra
+            etag = hashlib.sha256((etag + extra).encode("utf-8")).hexdigest()[:32]
+        resp = current_app.response_class(corpo + "}", mimetype="application/json")
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp.make_conditional(request)
 
     try:
         estabelecimento = _estabelecimento_atual()
@@ -63,15 +77,14 @@ def obter_view_schema():
         tipo_item = request.args.get("tipo_item") or "produto"
         if estabelecimento is None:
             # Super admin na visão global: schema por segmento explícito, sem overrides
-            schema = resolver_view_schema(
+            return _responder(compilar_view_schema(
                 segmento=request.args.get("segmento"),
                 familia_produto=familia_produto,
                 tipo_item=tipo_item,
-            )
-            return _sem_cache({"success": True, "schema": schema})
+            ))
 
         if quer_base:
-            base = resolver_view_schema(
+            base = compilar_view_schema(
                 segmento=estabelecimento.segmento,
                 familia_produto=familia_produto,
                 tipo_item=tipo_item,
@@ -80,17 +93,16 @@ def obter_view_schema():
             overrides = dict(overrides) if isinstance(overrides, dict) else {}
             overrides["mix_produtos"] = (
                 (estabelecimento.configuracoes or {}).get("mix_produtos")
-                or base.get("mix_permitido")
+                or base.schema.get("mix_permitido")
                 or []
             )
-            return _sem_cache({"success": True, "schema": base, "overrides": overrides})
+            return _responder(base, overrides)
 
-        schema = resolver_view_schema(
+        return _responder(compilar_view_schema(
             estabelecimento,
             familia_produto=familia_produto,
             tipo_item=tipo_item,
-        )
-        return _sem_cache({"success": True, "schema": schema})
+        ))
     except Exception as e:
         current_app.logger.error(f"Erro ao resolver view schema: {e}")
         return jsonify({"success": False, "error": "Erro ao resolver o schema de exibição"}), 500
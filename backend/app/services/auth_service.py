@@ -0,0 +1,244 @@
+"""
+Caminho rápido de autenticação.
+
+- UMA consulta traz funcionário + estabelecimento + plano (antes: SELECT do
+  funcionário, Estabelecimento.query.get e, em /validate e /profile, uma
+  consulta por coluna via get_*_safe).
+- A verificação do hash da senha roda num pool de CPU limitado: na troca de
+  turno dezenas de caixas logam ao mesmo tempo e o PBKDF2 saturava as threads
+  do worker, travando também as requisições que nada tinham a ver com login.
+- Histórico de login e auditoria saem da resposta: vão para uma fila e um
+  writer em background grava em lote.
+- /validate e /profile leem o contexto do funcionário de um cache in-process
+  com TTL curto (padrão de app.utils.abc_cache), derrubado no commit de
+  qualquer alteração do funcionário ou da loja dele.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, event, func, or_, select
+from werkzeug.security import check_password_hash
+
+from app.models import db, Auditoria, Estabelecimento, Funcionario, LoginHistory
+
+logger = logging.getLogger(__name__)
+
+_TTL_CONTEXTO = int(os.getenv("AUTH_CONTEXTO_TTL_SEC", "60"))
+_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+_HASH_TIMEOUT = 10  # s: se o pool estiver afogado, falha em vez de pendurar a thread
+
+_lock = threading.Lock()
+_cache: Dict[int, tuple] = {}
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+class AuthService:
+    """Consulta única de contexto, verificação de senha limitada e cache de perfil."""
+
+    @staticmethod
+    def _colunas():
+        f, e = Funcionario.__table__.c, Estabelecimento.__table__.c
+        return [
+            f.id, f.nome, f.email, f.username, f.senha, f.estabelecimento_id, f.cargo, f.role,
+            f.status, f.ativo, f.is_super_admin, f.permissoes, f.permissoes_json, f.foto_url, f.telefone, f.cpf,
+            f.data_admissao, f.data_demissao,
+            e.nome_fantasia.label("estab_nome"), e.razao_social.label("estab_razao_social"), e.cnpj.label("estab_cnpj"),
+            e.telefone.label("estab_telefone"), e.email.label("estab_email"),
+            e.logradouro.label("estab_logradouro"), e.cidade.label("estab_cidade"),
+            e.estado.label("estab_estado"), e.plano.label("estab_plano"),
+            e.plano_status.label("estab_plano_status"),
+        ]
+
+    @staticmethod
+    def _consultar(filtro) -> Optional[Dict]:
+        f, e = Funcionario.__table__, Estabelecimento.__table__
+        stmt = select(*AuthService._colunas()).select_from(
+            f.outerjoin(e, e.c.id == f.c.estabelecimento_id)
+        ).where(filtro).limit(1)
+        row = db.session.execute(stmt).mappings().first()
+        return dict(row) if row else None
+
+    @staticmethod
+    def buscar_para_login(identifier: str, apenas_ativos: bool = False) -> Optional[Dict]:
+        """Funcionário (por username OU e-mail) + estabelecimento + plano em UMA consulta.
+
+        ``apenas_ativos`` filtra antes do LIMIT 1: um cadastro inativo com o mesmo
+        e-mail não pode esconder o ativo."""
+        f = Funcionario.__table__.c
+        ident = identifier.lower()
+        filtro = or_(func.lower(f.username) == ident, func.lower(f.email) == ident)
+        if apenas_ativos:
+            filtro = and_(filtro, f.ativo.is_(True))
+        return AuthService._consultar(filtro)
+
+    @staticmethod
+    def contexto(funcionario_id: int) -> Optional[Dict]:
+        """Contexto do funcionário (sem o hash da senha), cacheado por TTL."""
+        key = int(funcionario_id)
+        now = time.monotonic()
+        hit = _cache.get(key)
+        if hit and (now - hit[0]) < _TTL_CONTEXTO:
+            return hit[1]
+
+        ctx = AuthService._consultar(Funcionario.__table__.c.id == key)
+        if ctx is None:
+            return None
+        ctx.pop("senha", None)
+        with _lock:
+            _cache[key] = (now, ctx)
+        return ctx
+
+    @staticmethod
+    def invalidar(funcionario_id=None) -> None:
+        """Invalida o contexto cacheado (de um funcionário ou todos) — usar após editar perfil/status."""
+        with _lock:
+            if funcionario_id is None:
+                _cache.clear()
+            else:
+                _cache.pop(int(funcionario_id), None)
+
+    @staticmethod
+    def invalidar_estabelecimentos(estabelecimento_ids) -> None:
+        """Invalida o contexto de todos os funcionários das lojas (plano/status da loja mudou)."""
+        ids = set(estabelecimento_ids)
+        with _lock:
+            for chave in [k for k, (_, ctx) in _cache.items() if ctx.get("estabelecimento_id") in ids]:
+                del _cache[chave]
+
+    @staticmethod
+    def verificar_senha(senha_hash: str, senha: str) -> bool:
+        """check_password_hash no pool limitado (hashlib libera o GIL durante o PBKDF2)."""
+        global _pool
+        if not senha_hash:
+            return False
+        if _pool is None:
+            with _lock:
+                if _pool is None:
+                    _pool = ThreadPoolExecutor(max_workers=_HASH_WORKERS, thread_name_prefix="auth-hash")
+        return _pool.submit(check_password_hash, senha_hash, senha).result(timeout=_HASH_TIMEOUT)
+
+
+# Qualquer escrita ORM em funcionário (ativo, role, status...) ou loja (plano,
+# plano_status...) derruba o contexto cacheado no commit, seja da tela de perfil
+# ou das rotas de administração; outros processos convergem pelo TTL.
+_PENDENTES = "auth_contexto_invalidar"
+
+
+@event.listens_for(db.session, "after_flush")
+def _marcar_contextos_alterados(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Funcionario) and obj.id is not None:
+            session.info.setdefault(_PENDENTES, (set(), set()))[0].add(obj.id)
+        elif isinstance(obj, Estabelecimento) and obj.id is not None:
+            session.info.setdefault(_PENDENTES, (set(), set()))[1].add(obj.id)
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidar_contextos_alterados(session):
+    funcionarios, lojas = session.info.pop(_PENDENTES, (set(), set()))
+    for funcionario_id in funcionarios:
+        AuthService.invalidar(funcionario_id)
+    if lojas:
+        AuthService.invalidar_estabelecimentos(lojas)
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _descartar_contextos_alterados(session, previous_transaction):
+    session.info.pop(_PENDENTES, None)
+
+
+class LoginHistoryWriter(threading.Thread):
+    """Grava login_history + auditoria de login em lote, fora do caminho da resposta."""
+
+    LOTE_MAX = 200
+
+    def __init__(self, app):
+        super().__init__(name="login-history-writer")
+        self.app = app
+        self.daemon = True
+        self.fila: "queue.Queue[Dict]" = queue.Queue()
+
+    def enfileirar(self, evento: Dict) -> None:
+        self.fila.put(evento)
+
+    def run(self):
+        while True:
+            lote = [self.fila.get()]
+            while len(lote) < self.LOTE_MAX:
+                try:
+                    lote.append(self.fila.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.app.app_context():
+                    gravar_eventos_login(lote)
+            except Exception as e:
+                logger.error(f"[LOGIN WRITER] Falha ao gravar {len(lote)} evento(s): {e}")
+            finally:
+                for _ in lote:
+                    self.fila.task_done()
+
+    def aguardar(self) -> None:
+        """Bloqueia até a fila esvaziar (shutdown ordenado)."""
+        self.fila.join()
+
+
+_writer: Optional[LoginHistoryWriter] = None
+
+
+def gravar_eventos_login(eventos: List[Dict]) -> None:
+    """Insere os eventos em lote (Core executemany: sem listener forense por linha)."""
+    agora = datetime.utcnow()
+    historico = [{
+        "funcionario_id": ev.get("funcionario_id"), "username": ev["username"][:100],
+        "estabelecimento_id": ev.get("estabelecimento_id"), "ip_address": (ev.get("ip_address") or "0.0.0.0")[:45],
+        "dispositivo": (ev.get("user_agent") or "Desconhecido")[:200], "user_agent": ev.get("user_agent"),
+        "success": ev["success"], "observacoes": ev.get("observacoes"),
+        "data_cadastro": ev.get("momento") or agora,
+    } for ev in eventos]
+    auditoria = [{
+        "estabelecimento_id": ev["estabelecimento_id"], "usuario_id": ev["funcionario_id"],
+        "tipo_evento": "login", "descricao": f"Login realizado por {ev['username']}",
+        "detalhes_json": {"contexto": ev.get("contexto"), "role": ev.get("role")},
+        "data_evento": ev.get("momento") or agora,
+    } for ev in eventos if ev["success"] and ev.get("estabelecimento_id")]
+
+    try:
+        db.session.execute(LoginHistory.__table__.insert(), historico)
+        if auditoria:
+            db.session.execute(Auditoria.__table__.insert(), auditoria)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def registrar_login(evento: Dict) -> None:
+    """Registra tentativa de login. Assíncrono por padrão; síncrono em TESTING
+    ou com LOGIN_HISTORY_ASYNC=false (SQLite em memória não é compartilhado
+    entre conexões)."""
+    global _writer
+    from flask import current_app
+
+    evento.setdefault("momento", datetime.utcnow())
+    if current_app.config.get("TESTING") or os.getenv("LOGIN_HISTORY_ASYNC", "true").lower() == "false":
+        try:
+            gravar_eventos_login([evento])
+        except Exception as e:
+            current_app.logger.warning(f"[AUDIT] Falha ao registrar login: {e}")
+        return
+
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _writer = LoginHistoryWriter(current_app._get_current_object())
+                _writer.start()
+                atexit.register(_writer.aguardar)
+    _writer.enfileirar(evento)
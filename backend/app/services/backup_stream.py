@@ -0,0 +1,502 @@
+"""
+Exportação e backup em streaming, com memória constante.
+
+Cada tabela é lida em lotes por cursor do lado do servidor
+(stream_results + yield_per, ordenado por id) e escrita direto num membro do
+ZIP (CSV, NDJSON ou Parquet), que vai saindo para o cliente/arquivo à medida
+que é comprimido — nada de DataFrame ou lista com a tabela inteira.
+
+- Cursor: no início da exportação fixa-se o MAX(id) de cada tabela e o
+  instante de corte (manifesto.json + header X-Backup-Cursor). Passado de
+  volta em `desde`, exporta só o que entrou (id > anterior) ou mudou
+  (updated_at > corte anterior) — backup incremental.
+- Retomada: `apos="tabela:id"` recomeça um download interrompido a partir
+  da última linha recebida, dentro do mesmo cursor.
+- Restauração (NDJSON): upsert por id em lotes — COPY para tabela temporária
+  + INSERT ... ON CONFLICT no PostgreSQL, executemany nos demais bancos.
+"""
+from __future__ import annotations
+
+import base64
+import csv
+import importlib.util
+import io
+import json
+import logging
+import os
+import zipfile
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy import bindparam, func, or_, select
+
+from app.models import db, utcnow
+
+logger = logging.getLogger(__name__)
+
+# Ordem de dependência (FK): a restauração segue a mesma ordem
+TABELAS_BACKUP = [
+    "estabelecimentos", "funcionarios", "clientes", "fornecedores", "categorias_produto", "produtos",
+    "vendas", "venda_itens", "pagamentos", "movimentacoes_estoque", "despesas",
+]
+# Tabelas de origem do razão financeiro mensal (financeiro_mensal_service)
+TABELAS_RAZAO = {"vendas", "venda_itens", "pagamentos", "despesas", "contas_pagar", "contas_receber"}
+FORMATOS = {"csv": "csv", "ndjson": "ndjson", "parquet": "parquet"}
+_LOTE = 2000
+_LOTE_RESTAURO = 1000
+
+
+class _Saida:
+    """Destino não-seekable do ZipFile: acumula o que foi comprimido até o
+    próximo `drenar` (o ZIP usa data descriptors e nunca volta atrás)."""
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+
+    def write(self, dados) -> int:
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self) -> None:
+        pass
+
+    def drenar(self) -> bytes:
+        dados = b"".join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+# ==================== CURSOR ====================
+
+def codificar_cursor(cursor: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursor, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(token: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not token:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        datetime.fromisoformat(cursor["corte"])
+        if not isinstance(cursor.get("tabelas"), dict):
+            raise ValueError
+        return cursor
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Cursor de backup inválido")
+
+
+def _tabela(nome: str) -> sa.Table:
+    return db.metadata.tables[nome]
+
+
+def _filtro_tenant(t: sa.Table, estabelecimento_id) -> list:
+    if estabelecimento_id in (None, "all"):
+        return []
+    if t.name == "estabelecimentos":
+        return [t.c.id == int(estabelecimento_id)]
+    if "estabelecimento_id" in t.c:
+        return [t.c.estabelecimento_id == int(estabelecimento_id)]
+    return []
+
+
+def marcar(estabelecimento_id, tabelas: Iterable[str]) -> Dict[str, Any]:
+    """Fotografia do início da exportação: MAX(id) por tabela e o corte."""
+    corte = utcnow()
+    marcas = {}
+    for nome in tabelas:
+        t = _tabela(nome)
+        marcas[nome] = db.session.execute(
+            select(func.coalesce(func.max(t.c.id), 0)).where(*_filtro_tenant(t, estabelecimento_id))
+        ).scalar()
+    return {"v": 1, "corte": corte.isoformat(), "tabelas": marcas}
+
+
+def _condicoes(t: sa.Table, estabelecimento_id, cursor, desde, apos_id) -> list:
+    condicoes = _filtro_tenant(t, estabelecimento_id) + [t.c.id <= cursor["tabelas"][t.name]]
+    if desde is not None:
+        novas = t.c.id > int(desde["tabelas"].get(t.name, 0))
+        if "updated_at" in t.c:
+            novas = or_(novas, t.c.updated_at > datetime.fromisoformat(desde["corte"]))
+        condicoes.append(novas)
+    if apos_id is not None:
+        condicoes.append(t.c.id > apos_id)
+    return condicoes
+
+
+def _lotes(t: sa.Table, condicoes: list, lote: int) -> Iterator[list]:
+    resultado = db.session.execute(
+        select(t).where(*condicoes).order_by(t.c.id).execution_options(stream_results=True, yield_per=lote)
+    )
+    try:
+        for parte in resultado.mappings().partitions(lote):
+            yield parte
+    finally:
+        resultado.close()
+
+
+# ==================== ESCRITORES ====================
+
+def _texto(valor) -> Any:
+    if valor is None:
+        return ""
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, ensure_ascii=False)
+    return valor
+
+
+def _json_default(valor):
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)  # preserva a precisão; a restauração converte de volta
+    if isinstance(valor, bytes):
+        return base64.b64encode(valor).decode()
+    return str(valor)
+
+
+def _escrever_csv(membro, t: sa.Table, lotes) -> Iterator[int]:
+    texto = io.TextIOWrapper(membro, encoding="utf-8", newline="", write_through=True)
+    escritor = csv.writer(texto)
+    colunas = [c.name for c in t.columns]
+    escritor.writerow(colunas)
+    for lote in lotes:
+        escritor.writerows([_texto(linha[c]) for c in colunas] for linha in lote)
+        yield len(lote)
+    texto.detach()
+
+
+def _escrever_ndjson(membro, t: sa.Table, lotes) -> Iterator[int]:
+    for lote in lotes:
+        membro.write("".join(
+            json.dumps(dict(linha), ensure_ascii=False, default=_json_default) + "\n" for linha in lote
+        ).encode("utf-8"))
+        yield len(lote)
+
+
+def _tipo_arrow(pa, coluna: sa.Column):
+    tipo = coluna.type
+    if isinstance(tipo, sa.Boolean):
+        return pa.bool_()
+    if isinstance(tipo, sa.Integer):
+        return pa.int64()
+    if isinstance(tipo, (sa.Numeric, sa.Float)):
+        return pa.float64()
+    if isinstance(tipo, sa.DateTime):
+        return pa.timestamp("us")
+    if isinstance(tipo, sa.Date):
+        return pa.date32()
+    return pa.string()
+
+
+def _escrever_parquet(membro, t: sa.Table, lotes) -> Iterator[int]:
+    import pyarrow as pa  # opcional: só quem exporta Parquet precisa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([(c.name, _tipo_arrow(pa, c)) for c in t.columns])
+    texto = {c.name for c in t.columns if pa.types.is_string(esquema.field(c.name).type)}
+    numerico = {c.name for c in t.columns if pa.types.is_float64(esquema.field(c.name).type)}
+
+    def _valor(nome, v):
+        if v is None:
+            return None
+        if nome in numerico:
+            return float(v)
+        if nome in texto and not isinstance(v, str):
+            return json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else str(_texto(v))
+        return v
+
+    with pq.ParquetWriter(pa.PythonFile(membro, mode="w"), esquema, compression="snappy") as escritor:
+        for lote in lotes:  # cada lote vira um row group
+            escritor.write_table(pa.Table.from_pylist(
+                [{k: _valor(k, v) for k, v in linha.items()} for linha in lote], schema=esquema))
+            yield len(lote)
+
+
+_ESCRITORES: Dict[str, Callable] = {"csv": _escrever_csv, "ndjson": _escrever_ndjson, "parquet": _escrever_parquet}
+
+
+# ==================== EXPORTAÇÃO ====================
+
+def exportar_zip(
+    estabelecimento_id,
+    tabelas: Iterable[str] = TABELAS_BACKUP,
+    formato: str = "csv",
+    desde: Optional[str] = None,
+    apos: Optional[str] = None,
+    cursor: Optional[str] = None,
+    extras: Optional[Dict[str, bytes]] = None,
+    lote: int = _LOTE,
+) -> Tuple[str, Iterator[bytes]]:
+    """(cursor, gerador de bytes do ZIP). Validações acontecem aqui, antes do
+    primeiro byte — erro de parâmetro ainda pode virar 400.
+
+    `desde`: cursor de um backup anterior (incremental). `apos` + `cursor`:
+    retoma um download interrompido ("tabela:id" da última linha recebida)."""
+    formato = (formato or "csv").lower()
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato inválido: {formato} (use {', '.join(FORMATOS)})")
+    if formato == "parquet":
+        if importlib.util.find_spec("pyarrow") is None:
+            raise ValueError("Exportação em Parquet requer o pacote pyarrow instalado no servidor")
+    tabelas = list(tabelas)
+    anterior = decodificar_cursor(desde)
+
+    apos_tabela, apos_id = None, None
+    if apos:
+        if not cursor:
+            raise ValueError("Para retomar (apos) informe também o cursor da exportação original")
+        apos_tabela, _, id_texto = apos.partition(":")
+        if apos_tabela not in tabelas or not id_texto.isdigit():
+            raise ValueError("Parâmetro 'apos' inválido (esperado tabela:id)")
+        apos_id = int(id_texto)
+        atual = decodificar_cursor(cursor)
+        tabelas = tabelas[tabelas.index(apos_tabela):]
+    else:
+        atual = marcar(estabelecimento_id, tabelas)
+    token = codificar_cursor(atual)
+    escrever = _ESCRITORES[formato]
+
+    manifesto = {
+        "sistema": "MercadinhoSys", "formato": formato, "estabelecimento_id": estabelecimento_id,
+        "gerado_em": utcnow().isoformat(), "cursor": token, "incremental": anterior is not None,
+        "retomado_apos": apos, "tabelas": {
+            nome: [{"nome": c.name, "tipo": str(c.type)} for c in _tabela(nome).columns] for nome in tabelas
+        },
+    }
+
+    def _gerar() -> Iterator[bytes]:
+        saida = _Saida()
+        contagens = {}
+        with zipfile.ZipFile(saida, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("manifesto.json", json.dumps(manifesto, ensure_ascii=False, indent=2))
+            for nome, conteudo in (extras or {}).items():
+                zf.writestr(nome, conteudo)
+            yield saida.drenar()
+            for nome in tabelas:
+                t = _tabela(nome)
+                condicoes = _condicoes(t, estabelecimento_id, atual, anterior,
+                                       apos_id if nome == apos_tabela else None)
+                contagens[nome] = 0
+                with zf.open(f"{nome}.{FORMATOS[formato]}", mode="w", force_zip64=True) as membro:
+                    for n in escrever(membro, t, _lotes(t, condicoes, lote)):
+                        contagens[nome] += n
+                        dados = saida.drenar()
+                        if dados:
+                            yield dados
+                yield saida.drenar()
+            zf.writestr("contagens.json", json.dumps(contagens))
+        yield saida.drenar()
+        logger.info(f"[BACKUP] Exportação {formato} concluída: {contagens}")
+
+    return token, _gerar()
+
+
+def gravar_zip(caminho: str, gerador: Iterable[bytes]) -> int:
+    """Grava o ZIP em disco (arquivo .part renomeado no fim): um backup
+    interrompido nunca deixa um .zip truncado com cara de válido."""
+    parcial = f"{caminho}.part"
+    total = 0
+    with open(parcial, "wb") as f:
+        for bloco in gerador:
+            f.write(bloco)
+            total += len(bloco)
+    os.replace(parcial, caminho)
+    return total
+
+
+# ==================== RESTAURAÇÃO ====================
+
+def _conversores(t: sa.Table) -> Dict[str, Callable]:
+    conversores = {}
+    for c in t.columns:
+        tipo = c.type
+        if isinstance(tipo, sa.DateTime):
+            conversores[c.name] = datetime.fromisoformat
+        elif isinstance(tipo, sa.Date):
+            conversores[c.name] = lambda v: date.fromisoformat(v[:10])
+        elif isinstance(tipo, sa.Time):
+            conversores[c.name] = time.fromisoformat
+        elif isinstance(tipo, sa.Numeric) and not isinstance(tipo, sa.Float):
+            conversores[c.name] = lambda v: Decimal(str(v))
+        elif isinstance(tipo, sa.Boolean):
+            conversores[c.name] = lambda v: v if isinstance(v, bool) else str(v).lower() in ("1", "true", "t")
+    return conversores
+
+
+def _normalizar(t: sa.Table, conversores, linha: dict) -> dict:
+    limpa = {}
+    for chave, valor in linha.items():
+        if chave not in t.c:
+            continue
+        if valor is not None and chave in conversores and isinstance(valor, (str, int, float)):
+            valor = conversores[chave](valor)
+        limpa[chave] = valor
+    return limpa
+
+
+def _upsert_generico(t: sa.Table, linhas: List[dict], estabelecimento_id) -> Dict[str, int]:
+    tenant = "estabelecimento_id" in t.c
+    ids = [l["id"] for l in linhas]
+    colunas = [t.c.id, t.c.estabelecimento_id] if tenant else [t.c.id]
+    existentes = {
+        r[0]: (r[1] if tenant else None)
+        for r in db.session.execute(select(*colunas).where(t.c.id.in_(ids)))
+    }
+
+    novas, atualizar, conflitos = [], [], 0
+    for linha in linhas:
+        if linha["id"] not in existentes:
+            novas.append(linha)
+        elif tenant and existentes[linha["id"]] != linha.get("estabelecimento_id"):
+            conflitos += 1  # id já usado por outra loja: nunca sobrescreve dado alheio
+        else:
+            atualizar.append(linha)
+    if novas:
+        db.session.execute(t.insert(), novas)  # executemany
+    if atualizar:
+        colunas = [c for c in atualizar[0] if c != "id"]
+        stmt = t.update().where(t.c.id == bindparam("b_id")).values({c: bindparam(f"b_{c}") for c in colunas})
+        db.session.execute(stmt, [{f"b_{k}": v for k, v in linha.items()} for linha in atualizar])
+    return {"inseridos": len(novas), "atualizados": len(atualizar), "conflitos": conflitos}
+
+
+def _upsert_postgres(t: sa.Table, linhas: List[dict], estabelecimento_id) -> Dict[str, int]:
+    colunas = [c.name for c in t.columns if c.name in linhas[0]]
+    temporaria = f"_restauro_{t.name}"
+    lista = ", ".join(f'"{c}"' for c in colunas)
+    buf = io.StringIO()
+    escritor = csv.writer(buf)
+    for linha in linhas:
+        escritor.writerow(["\\N" if linha.get(c) is None else _texto(linha.get(c)) for c in colunas])
+    buf.seek(0)
+
+    # Tabela particionada (flask particionar-tabelas): a PK é (id, chave de partição)
+    from app.services.particionamento_service import ParticionamentoService
+    chaves = ParticionamentoService.tabelas()
+    pk = ["id"]
+    if t.name in chaves and t.name in ParticionamentoService.particionadas():
+        pk.append(chaves[t.name])
+    alvo = ", ".join(f'"{c}"' for c in pk)
+
+    cur = db.session.connection().connection.cursor()
+    try:
+        cur.execute(f'CREATE TEMP TABLE IF NOT EXISTS "{temporaria}" (LIKE "{t.name}" INCLUDING DEFAULTS) ON COMMIT DROP')
+        cur.execute(f'TRUNCATE "{temporaria}"')
+        cur.copy_expert(f'COPY "{temporaria}" ({lista}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')', buf)
+        atualizacao = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in colunas if c not in pk)
+        guarda = f' WHERE "{t.name}".estabelecimento_id = EXCLUDED.estabelecimento_id' if "estabelecimento_id" in t.c else ""
+        cur.execute(
+            f'INSERT INTO "{t.name}" ({lista}) SELECT {lista} FROM "{temporaria}" '
+            f'ON CONFLICT ({alvo}) DO UPDATE SET {atualizacao}{guarda}'
+        )
+        gravadas = cur.rowcount
+    finally:
+        cur.close()
+    return {"inseridos": gravadas, "atualizados": 0, "conflitos": len(linhas) - gravadas}
+
+
+def restaurar_linhas(nome: str, linhas: Iterable[dict], estabelecimento_id=None,
+                     lote: int = _LOTE_RESTAURO) -> Dict[str, int]:
+    """Upsert em lotes das linhas de uma tabela. Com `estabelecimento_id`,
+    linhas de outra loja são ignoradas."""
+    t = _tabela(nome)
+    conversores = _conversores(t)
+    postgres = db.session.get_bind().dialect.name == "postgresql"
+    upsert = _upsert_postgres if postgres else _upsert_generico
+    total = {"inseridos": 0, "atualizados": 0, "conflitos": 0, "ignorados": 0}
+    filtro = _filtro_tenant(t, estabelecimento_id)
+    campo_tenant = "id" if nome == "estabelecimentos" else "estabelecimento_id"
+
+    def _descarregar(pendentes):
+        for chave, valor in upsert(t, pendentes, estabelecimento_id).items():
+            total[chave] += valor
+
+    pendentes = []
+    for linha in linhas:
+        linha = _normalizar(t, conversores, linha)
+        if "id" not in linha:
+            total["ignorados"] += 1
+            continue
+        if filtro and linha.get(campo_tenant) != int(estabelecimento_id):
+            total["ignorados"] += 1
+            continue
+        pendentes.append(linha)
+        if len(pendentes) >= lote:
+            _descarregar(pendentes)
+            pendentes = []
+    if pendentes:
+        _descarregar(pendentes)
+    return total
+
+
+def _realinhar_sequencias(tabelas: Iterable[str]) -> None:
+    """Ids explícitos não avançam a sequence no PostgreSQL (ver scripts/fix_sequences.py)."""
+    if db.session.get_bind().dialect.name != "postgresql":
+        return
+    for nome in tabelas:
+        db.session.execute(sa.text(
+            f"SELECT setval(pg_get_serial_sequence('{nome}', 'id'), "
+            f"GREATEST((SELECT COALESCE(MAX(id), 0) FROM \"{nome}\"), 1))"
+        ))
+
+
+def reconciliar_razao(restaurado: Dict[str, Dict[str, int]], estabelecimento_id=None) -> None:
+    """O upsert grava direto na tabela, sem os listeners que mantêm o razão
+    financeiro mensal: depois do commit, reconstrói o razão das lojas afetadas
+    se alguma tabela de origem recebeu linhas."""
+    if not any(nome in TABELAS_RAZAO and (c.get("inseridos") or c.get("atualizados"))
+               for nome, c in restaurado.items()):
+        return
+    from app.models import Estabelecimento
+    from app.services.financeiro_mensal_service import FinanceiroMensalService
+
+    if estabelecimento_id is not None:
+        lojas = [int(estabelecimento_id)]
+    else:
+        lojas = db.session.execute(select(Estabelecimento.id)).scalars().all()
+    for estab_id in lojas:
+        try:
+            FinanceiroMensalService.reconciliar_estabelecimento(estab_id)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Razão financeiro do estabelecimento {estab_id} não reconciliado após o restauro: {e}")
+
+
+def _ler_ndjson(arquivo) -> Iterator[dict]:
+    for linha in io.TextIOWrapper(arquivo, encoding="utf-8"):
+        linha = linha.strip()
+        if linha:
+            yield json.loads(linha)
+
+
+def restaurar_zip(arquivo, estabelecimento_id=None, lote: int = _LOTE_RESTAURO) -> Dict[str, Dict[str, int]]:
+    """Restaura um backup NDJSON gerado por `exportar_zip` (completo ou
+    incremental), tabela a tabela na ordem de dependência, num commit só."""
+    with zipfile.ZipFile(arquivo) as zf:
+        try:
+            manifesto = json.loads(zf.read("manifesto.json"))
+        except KeyError:
+            raise ValueError("Arquivo não é um backup do sistema (manifesto.json ausente)")
+        if manifesto.get("formato") != "ndjson":
+            raise ValueError("Só backups em NDJSON podem ser restaurados (CSV/Parquet são para análise)")
+        nomes = set(zf.namelist())
+        restaurado = {}
+        try:
+            for nome in TABELAS_BACKUP:
+                membro = f"{nome}.ndjson"
+                if membro not in nomes:
+                    continue
+                with zf.open(membro) as f:
+                    restaurado[nome] = restaurar_linhas(nome, _ler_ndjson(f), estabelecimento_id, lote)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    _realinhar_sequencias(restaurado)
+    db.session.commit()
+    reconciliar_razao(restaurado, estabelecimento_id)
+    return restaurado
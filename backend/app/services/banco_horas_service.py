@@ -0,0 +1,248 @@
+"""
+Banco de horas como razão só de inserção (tabela banco_horas_lancamentos).
+
+O saldo de um dia é ``minutos trabalhados - jornada esperada`` (jornada da
+ConfiguracaoHorario em dias úteis, seg–sex; zero no fim de semana), contado só
+em dias fechados (com entrada e saída). Justificativa aprovada para o dia abona
+o débito (saldo negativo vira zero; crédito é mantido).
+
+Toda vez que o dia de um funcionário é reconsolidado — batida registrada,
+ajustada ou excluída (PontoDiarioService.recalcular_dia) ou justificativa
+respondida — ``lancar_dia`` compara o novo valor do dia com o do último
+lançamento daquele dia e, se mudou, grava um lançamento com o delta e o saldo
+corrido. Nada é atualizado nem apagado: correções viram lançamentos novos. O
+resumo mensal BancoHoras (listado em /rh/banco-horas) é ajustado pelo mesmo
+delta.
+
+Saldo atual ou em qualquer instante passado = último lançamento até ali, uma
+busca no índice (funcionario_id, sequencia/criado_em), sem somar o histórico.
+
+``verificar`` é o conferidor: refaz o valor de cada dia de um intervalo direto
+das batidas (RegistroPonto, com a mesma regra do espelho) e das justificativas,
+compara com o razão e, com ``corrigir``, grava lançamentos de reconciliação.
+Também serve de carga inicial do histórico (``flask verificar-banco-horas
+--corrigir``). Trocar a jornada não reescreve o passado; rode o conferidor com
+correção se a jornada nova deve valer para dias já lançados.
+"""
+import logging
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import func
+
+from app.models import (
+    db, BancoHoras, BancoHorasLancamento, ConfiguracaoHorario, JustificativaPonto, PontoDiario, RegistroPonto,
+    allow_all_tenants,
+)
+from app.services.rh_calculator_service import JORNADA_PADRAO_MIN
+
+logger = logging.getLogger(__name__)
+
+def minutos_esperados(dia: date, jornada_min: int) -> int:
+    return jornada_min if dia.weekday() < 5 else 0
+
+
+def valor_do_dia(dia: date, minutos_trabalhados: int, fechado: bool, abonado: bool, jornada_min: int):
+    """(trabalhados, esperados, saldo do dia) — dia sem entrada e saída não conta."""
+    if not fechado:
+        return 0, 0, 0
+    esperados = minutos_esperados(dia, jornada_min)
+    valor = minutos_trabalhados - esperados
+    if abonado and valor < 0:
+        valor = 0
+    return minutos_trabalhados, esperados, valor
+
+
+class BancoHorasService:
+    # ------------------------------------------------------------------
+    # Leituras pontuais (índice)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def ultimo(funcionario_id, em: Optional[datetime] = None) -> Optional[BancoHorasLancamento]:
+        consulta = BancoHorasLancamento.query.filter(BancoHorasLancamento.funcionario_id == funcionario_id)
+        if em is not None:
+            consulta = consulta.filter(BancoHorasLancamento.criado_em <= em)
+        return consulta.order_by(BancoHorasLancamento.sequencia.desc()).first()
+
+    @staticmethod
+    def saldo(funcionario_id, em: Optional[datetime] = None) -> int:
+        """Saldo em minutos agora ou no instante ``em`` (como estava registrado então)."""
+        ultimo = BancoHorasService.ultimo(funcionario_id, em)
+        return ultimo.saldo_minutos if ultimo else 0
+
+    @staticmethod
+    def _ultimo_do_dia(funcionario_id, dia) -> Optional[BancoHorasLancamento]:
+        return (BancoHorasLancamento.query
+                .filter(BancoHorasLancamento.funcionario_id == funcionario_id, BancoHorasLancamento.data == dia)
+                .order_by(BancoHorasLancamento.sequencia.desc())
+                .first())
+
+    @staticmethod
+    def _abonado(funcionario_id, dia) -> bool:
+        return db.session.query(JustificativaPonto.id).filter(
+            JustificativaPonto.funcionario_id == funcionario_id,
+            JustificativaPonto.data == dia,
+            JustificativaPonto.status == "aprovado",
+        ).first() is not None
+
+    # ------------------------------------------------------------------
+    # Escrita
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _lancar(funcionario_id, estabelecimento_id, dia, trabalhados, esperados, valor, origem,
+                referencia_id=None, anterior_dia=None) -> Optional[BancoHorasLancamento]:
+        """Grava o lançamento se o estado do dia mudou (quem chama faz o commit)."""
+        antes = ((anterior_dia.minutos_trabalhados, anterior_dia.minutos_esperados, anterior_dia.valor_dia)
+                 if anterior_dia else (0, 0, 0))
+        if (trabalhados, esperados, valor) == antes:
+            return None
+        delta = valor - antes[2]
+        ultimo = BancoHorasService.ultimo(funcionario_id)
+        lancamento = BancoHorasLancamento(
+            estabelecimento_id=estabelecimento_id, funcionario_id=funcionario_id,
+            sequencia=(ultimo.sequencia + 1) if ultimo else 1, data=dia, origem=origem,
+            referencia_id=referencia_id, minutos_trabalhados=trabalhados, minutos_esperados=esperados,
+            valor_dia=valor, delta_minutos=delta, saldo_minutos=(ultimo.saldo_minutos if ultimo else 0) + delta,
+        )
+        db.session.add(lancamento)
+        BancoHorasService._ajustar_mes(funcionario_id, estabelecimento_id, dia, delta,
+                                       trabalhados - antes[0], esperados - antes[1])
+        db.session.flush()
+        return lancamento
+
+    @staticmethod
+    def _ajustar_mes(funcionario_id, estabelecimento_id, dia, delta, delta_trabalhados, delta_esperados):
+        mes = dia.strftime("%Y-%m")
+        resumo = BancoHoras.query.filter_by(funcionario_id=funcionario_id, mes_referencia=mes).first()
+        if resumo is None:
+            resumo = BancoHoras(funcionario_id=funcionario_id, estabelecimento_id=estabelecimento_id,
+                                mes_referencia=mes, saldo_minutos=0, horas_trabalhadas_minutos=0,
+                                horas_esperadas_minutos=0)
+            db.session.add(resumo)
+        resumo.saldo_minutos = (resumo.saldo_minutos or 0) + delta
+        resumo.horas_trabalhadas_minutos = (resumo.horas_trabalhadas_minutos or 0) + delta_trabalhados
+        resumo.horas_esperadas_minutos = (resumo.horas_esperadas_minutos or 0) + delta_esperados
+
+    @staticmethod
+    def lancar_dia(funcionario_id, estabelecimento_id, dia, linha: Optional[PontoDiario],
+                   jornada_min=None, origem="ponto", referencia_id=None) -> Optional[BancoHorasLancamento]:
+        """Reflete no razão o dia já reconsolidado. ``linha`` é o PontoDiario do
+        dia, ou None se o dia ficou sem batidas (quem chama faz o commit)."""
+        if jornada_min is None:
+            from app.services.ponto_diario_service import PontoDiarioService
+            jornada_min = PontoDiarioService.jornada(estabelecimento_id)
+        fechado = bool(linha is not None and linha.primeira_entrada and linha.ultima_saida)
+        trabalhados, esperados, valor = valor_do_dia(
+            dia, (linha.minutos_trabalhados or 0) if linha is not None else 0, fechado,
+            BancoHorasService._abonado(funcionario_id, dia), jornada_min,
+        )
+        return BancoHorasService._lancar(
+            funcionario_id, estabelecimento_id, dia, trabalhados, esperados, valor, origem,
+            referencia_id=referencia_id, anterior_dia=BancoHorasService._ultimo_do_dia(funcionario_id, dia),
+        )
+
+    @staticmethod
+    def reavaliar_dia(funcionario_id, estabelecimento_id, dia, origem="justificativa",
+                      referencia_id=None) -> Optional[BancoHorasLancamento]:
+        """Relança um dia sem mexer nas batidas (ex.: justificativa aprovada/rejeitada)."""
+        linha = PontoDiario.query.filter_by(funcionario_id=funcionario_id, data=dia).first()
+        return BancoHorasService.lancar_dia(funcionario_id, estabelecimento_id, dia, linha,
+                                            origem=origem, referencia_id=referencia_id)
+
+    # ------------------------------------------------------------------
+    # Conferência / reconstrução a partir das fontes
+    # ------------------------------------------------------------------
+    @staticmethod
+    def verificar(estabelecimento_id=None, data_inicio=None, data_fim=None, funcionario_id=None,
+                  corrigir=False) -> dict:
+        """
+        Refaz os dias do intervalo direto das batidas e justificativas e compara
+        com o razão. Retorna as divergências por dia e as cadeias de saldo
+        quebradas; com ``corrigir`` grava lançamentos de reconciliação (commit).
+        """
+        from app.services.ponto_diario_service import consolidar
+
+        with allow_all_tenants():
+            def _filtrar(consulta, modelo, campo_data):
+                if estabelecimento_id:
+                    consulta = consulta.filter(modelo.estabelecimento_id == estabelecimento_id)
+                if funcionario_id:
+                    consulta = consulta.filter(modelo.funcionario_id == funcionario_id)
+                if data_inicio:
+                    consulta = consulta.filter(campo_data >= data_inicio)
+                if data_fim:
+                    consulta = consulta.filter(campo_data <= data_fim)
+                return consulta
+
+            jornadas = defaultdict(lambda: JORNADA_PADRAO_MIN)
+            for estab_id, jornada in db.session.query(ConfiguracaoHorario.estabelecimento_id,
+                                                      ConfiguracaoHorario.jornada_diaria_minutos):
+                if jornada:
+                    jornadas[estab_id] = jornada
+
+            abonados = set(_filtrar(
+                db.session.query(JustificativaPonto.funcionario_id, JustificativaPonto.data)
+                .filter(JustificativaPonto.status == "aprovado"),
+                JustificativaPonto, JustificativaPonto.data,
+            ).all())
+
+            # Esperado: a partir das batidas, agrupadas por funcionário/dia
+            esperado = {}
+            batidas = defaultdict(list)
+            for r in _filtrar(db.session.query(RegistroPonto), RegistroPonto, RegistroPonto.data).order_by(
+                    RegistroPonto.funcionario_id, RegistroPonto.data, RegistroPonto.hora):
+                batidas[(r.funcionario_id, r.estabelecimento_id, r.data)].append(r)
+            for (fid, estab_id, dia), registros in batidas.items():
+                dados = consolidar(registros, jornadas[estab_id])
+                fechado = bool(dados["primeira_entrada"] and dados["ultima_saida"])
+                esperado[(fid, dia)] = (estab_id, *valor_do_dia(
+                    dia, dados["minutos_trabalhados"], fechado, (fid, dia) in abonados, jornadas[estab_id]))
+
+            # Razão: último lançamento de cada funcionário/dia do intervalo
+            ultimo_seq = _filtrar(
+                db.session.query(BancoHorasLancamento.funcionario_id, BancoHorasLancamento.data,
+                                 func.max(BancoHorasLancamento.sequencia).label("seq")),
+                BancoHorasLancamento, BancoHorasLancamento.data,
+            ).group_by(BancoHorasLancamento.funcionario_id, BancoHorasLancamento.data).subquery()
+            atuais = {
+                (l.funcionario_id, l.data): l
+                for l in db.session.query(BancoHorasLancamento).join(
+                    ultimo_seq, (BancoHorasLancamento.funcionario_id == ultimo_seq.c.funcionario_id)
+                    & (BancoHorasLancamento.sequencia == ultimo_seq.c.seq))
+            }
+
+            divergencias = []
+            for chave in sorted(set(esperado) | set(atuais), key=lambda c: (c[0], c[1])):
+                fid, dia = chave
+                atual = atuais.get(chave)
+                estab_id, trabalhados, esperados, valor = esperado.get(
+                    chave, (atual.estabelecimento_id if atual else None, 0, 0, 0))
+                if (atual.valor_dia if atual else 0) == valor:
+                    continue
+                divergencias.append({"funcionario_id": fid, "data": dia.isoformat(),
+                                     "no_razao": atual.valor_dia if atual else None, "esperado": valor})
+                if corrigir:
+                    BancoHorasService._lancar(fid, estab_id, dia, trabalhados, esperados, valor,
+                                              "reconciliacao", anterior_dia=atual)
+
+            # Cadeia de saldo: último saldo de cada funcionário == soma dos deltas
+            somas = db.session.query(BancoHorasLancamento.funcionario_id,
+                                     func.sum(BancoHorasLancamento.delta_minutos),
+                                     func.max(BancoHorasLancamento.sequencia))
+            if estabelecimento_id:
+                somas = somas.filter(BancoHorasLancamento.estabelecimento_id == estabelecimento_id)
+            if funcionario_id:
+                somas = somas.filter(BancoHorasLancamento.funcionario_id == funcionario_id)
+            cadeias_quebradas = []
+            for fid, soma, seq in somas.group_by(BancoHorasLancamento.funcionario_id):
+                saldo = db.session.query(BancoHorasLancamento.saldo_minutos).filter_by(
+                    funcionario_id=fid, sequencia=seq).scalar()
+                if saldo != int(soma or 0):
+                    cadeias_quebradas.append({"funcionario_id": fid, "saldo": saldo, "soma_deltas": int(soma or 0)})
+
+            if corrigir and divergencias:
+                db.session.commit()
+                logger.info("Banco de horas: %s dia(s) reconciliados", len(divergencias))
+            return {"divergencias": divergencias, "corrigidos": len(divergencias) if corrigir else 0,
+                    "cadeias_quebradas": cadeias_quebradas}
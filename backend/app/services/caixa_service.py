@@ -0,0 +1,130 @@
+"""
+Totais do caixa (PDV).
+
+Resumo e fechamento leem os totais correntes de caixa_totais, mantidos
+atomicamente a cada movimentação (ver listeners em app.models). O livro
+movimentacoes_caixa continua sendo a fonte da verdade: `reconciliar` confere
+os totais contra um GROUP BY do livro e, se pedido, os reconstrói.
+"""
+import logging
+from decimal import Decimal
+from typing import Dict, List
+
+from sqlalchemy import func
+
+from app.models import db, CaixaTotal, MovimentacaoCaixa, normalizar_forma_caixa
+
+logger = logging.getLogger(__name__)
+
+
+class CaixaService:
+    FORMAS_FIXAS = ("dinheiro", "cartao_debito", "cartao_credito", "pix", "fiado")
+
+    @staticmethod
+    def totais(caixa_id: int) -> Dict:
+        """Totais do turno a partir de caixa_totais (uma consulta, poucas linhas)."""
+        por_forma = {f: {"quantidade": 0, "total": 0.0} for f in CaixaService.FORMAS_FIXAS}
+        resultado = {"total_vendas": 0.0, "total_sangrias": 0.0, "total_suprimentos": 0.0}
+
+        linhas = db.session.query(
+            CaixaTotal.tipo, CaixaTotal.forma_pagamento, CaixaTotal.quantidade, CaixaTotal.total
+        ).filter(CaixaTotal.caixa_id == caixa_id).all()
+
+        for tipo, forma, quantidade, total in linhas:
+            valor = float(total or 0)
+            if tipo == "venda":
+                item = por_forma.setdefault(forma, {"quantidade": 0, "total": 0.0})
+                item["quantidade"] += int(quantidade or 0)
+                item["total"] += valor
+                resultado["total_vendas"] += valor
+            elif tipo == "sangria":
+                resultado["total_sangrias"] += valor
+            elif tipo == "suprimento":
+                resultado["total_suprimentos"] += valor
+            # 'abertura' e 'fechamento' não entram no cálculo de vendas/sangrias/suprimentos
+
+        resultado["por_forma_pagamento"] = por_forma
+        return resultado
+
+    @staticmethod
+    def saldo_esperado_gaveta(caixa, totais: Dict) -> float:
+        """Dinheiro Inicial + Vendas Dinheiro + Suprimentos - Sangrias."""
+        return (
+            float(caixa.saldo_inicial or 0)
+            + totais["por_forma_pagamento"]["dinheiro"]["total"]
+            + totais["total_suprimentos"]
+            - totais["total_sangrias"]
+        )
+
+    @staticmethod
+    def _totais_do_livro(caixa_id: int) -> Dict[tuple, Dict]:
+        """Recalcula os totais direto do livro (GROUP BY no banco)."""
+        linhas = db.session.query(
+            func.lower(MovimentacaoCaixa.tipo), MovimentacaoCaixa.forma_pagamento,
+            func.count(MovimentacaoCaixa.id), func.coalesce(func.sum(MovimentacaoCaixa.valor), 0),
+        ).filter(MovimentacaoCaixa.caixa_id == caixa_id).group_by(
+            func.lower(MovimentacaoCaixa.tipo), MovimentacaoCaixa.forma_pagamento
+        ).all()
+
+        agregados: Dict[tuple, Dict] = {}
+        for tipo, forma, quantidade, total in linhas:
+            item = agregados.setdefault((tipo, normalizar_forma_caixa(forma)), {"quantidade": 0, "total": Decimal("0")})
+            item["quantidade"] += int(quantidade)
+            item["total"] += Decimal(str(total))
+        return agregados
+
+    @staticmethod
+    def reconciliar(caixa_id: int, corrigir: bool = False) -> Dict:
+        """
+        Confere caixa_totais contra o livro de movimentações.
+
+        Args:
+            caixa_id: caixa a conferir.
+            corrigir: se True, reconstrói caixa_totais a partir do livro quando houver divergência.
+
+        Returns:
+            {"consistente": bool, "divergencias": [...], "corrigido": bool}
+        """
+        livro = CaixaService._totais_do_livro(caixa_id)
+        persistidos = {
+            (t.tipo, t.forma_pagamento): {"quantidade": int(t.quantidade or 0), "total": Decimal(str(t.total or 0))}
+            for t in CaixaTotal.query.filter_by(caixa_id=caixa_id).all()
+        }
+
+        divergencias: List[Dict] = []
+        for chave in sorted(set(livro) | set(persistidos)):
+            esperado = livro.get(chave, {"quantidade": 0, "total": Decimal("0")})
+            atual = persistidos.get(chave, {"quantidade": 0, "total": Decimal("0")})
+            if esperado["quantidade"] != atual["quantidade"] or abs(esperado["total"] - atual["total"]) > Decimal("0.0001"):
+                divergencias.append({
+                    "tipo": chave[0], "forma_pagamento": chave[1],
+                    "livro": {"quantidade": esperado["quantidade"], "total": float(esperado["total"])},
+                    "totais": {"quantidade": atual["quantidade"], "total": float(atual["total"])},
+                })
+
+        corrigido = False
+        if divergencias:
+            logger.warning(f"Caixa {caixa_id}: {len(divergencias)} divergência(s) entre caixa_totais e o livro.")
+            if corrigir:
+                CaixaService._reconstruir(caixa_id, livro)
+                corrigido = True
+
+        return {"consistente": not divergencias, "divergencias": divergencias, "corrigido": corrigido}
+
+    @staticmethod
+    def _reconstruir(caixa_id: int, livro: Dict[tuple, Dict]) -> None:
+        from app.models import Caixa
+
+        caixa = db.session.get(Caixa, caixa_id)
+        tabela = CaixaTotal.__table__
+        db.session.execute(tabela.delete().where(tabela.c.caixa_id == caixa_id))
+        if livro:
+            db.session.execute(tabela.insert(), [
+                {
+                    "estabelecimento_id": caixa.estabelecimento_id, "caixa_id": caixa_id,
+                    "tipo": tipo, "forma_pagamento": forma,
+                    "quantidade": v["quantidade"], "total": v["total"],
+                }
+                for (tipo, forma), v in livro.items()
+            ])
+        db.session.commit()
@@ -0,0 +1,298 @@
+"""
+Carrinho do PDV com estado quente e controle otimista (tabela carrinhos_pdv).
+
+Cada bipe do caixa recarregava a Venda em andamento, regravava VendaItem e os
+totais pelo ORM (auditoria e fila de sync a cada item). Aqui o carrinho vive
+numa linha de carrinhos_pdv:
+
+- operações em lote (adicionar, quantidade, remover): N produtos bipados numa
+  chamada, com os produtos lidos numa consulta só;
+- gravação por UPDATE condicional na versão lida (compare-and-set): quem
+  informa ``versao`` desatualizada recebe CarrinhoConflito com o estado atual;
+  sem ``versao``, a operação é reaplicada sobre o estado novo;
+- Venda/VendaItem (status em_andamento) recebem o carrinho só no checkpoint,
+  a cada CARRINHO_CHECKPOINT_OPS versões ou CARRINHO_CHECKPOINT_SEGUNDOS, e a
+  venda final é gravada pelo /api/pdv/finalizar com ``carrinho_id``.
+
+A linha é durável (mesmo banco), então um terminal reiniciado retoma o
+carrinho por /pdv/<venda_id>/carrinho. Vendas em andamento sem linha (abertas
+antes desta tabela) são recriadas a partir do último checkpoint em VendaItem.
+O flask-caching não serve de armazenamento aqui: não tem compare-and-set e o
+SimpleCache não é compartilhado entre workers.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.models import db, CarrinhoPdv, Produto, Venda, VendaItem, utcnow
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_OPERACOES = int(os.environ.get("CARRINHO_CHECKPOINT_OPS", "20"))
+CHECKPOINT_SEGUNDOS = int(os.environ.get("CARRINHO_CHECKPOINT_SEGUNDOS", "60"))
+_TENTATIVAS = 3
+_OPERACOES = ("adicionar", "quantidade", "remover")
+
+
+class CarrinhoErro(Exception):
+    """Operação recusada (produto inexistente, estoque, carrinho encerrado...)."""
+
+    def __init__(self, mensagem, status_code=400):
+        self.mensagem = mensagem
+        self.status_code = status_code
+        super().__init__(mensagem)
+
+
+class CarrinhoConflito(Exception):
+    """A versão do carrinho mudou entre a leitura e a gravação."""
+
+    def __init__(self, carrinho):
+        self.carrinho = carrinho
+        super().__init__(f"Carrinho alterado em outro terminal (versão atual {carrinho.versao})")
+
+
+def _dec(valor) -> Decimal:
+    return Decimal(str(valor or 0))
+
+
+def _totais(itens, desconto) -> dict:
+    subtotal = sum((_dec(l["total_item"]) for l in itens), Decimal("0"))
+    return {
+        "subtotal": subtotal,
+        "total": max(Decimal("0"), subtotal - _dec(desconto)),
+        "quantidade_itens": sum((_dec(l["quantidade"]) for l in itens), Decimal("0")),
+    }
+
+
+class CarrinhoService:
+    @staticmethod
+    def abrir(estabelecimento_id, funcionario_id, cliente_id=None):
+        """Abre o carrinho e a Venda em andamento que o identifica (``venda_id``)."""
+        codigo_temp = f"PDV-{datetime.now().strftime('%H%M%S')}-{funcionario_id}"
+        venda = Venda(
+            estabelecimento_id=estabelecimento_id, codigo=codigo_temp, cliente_id=cliente_id,
+            funcionario_id=funcionario_id, subtotal=0, desconto=0, total=0, valor_recebido=0, troco=0,
+            status="em_andamento", quantidade_itens=0,
+        )
+        db.session.add(venda)
+        db.session.flush()
+        carrinho = CarrinhoPdv(
+            estabelecimento_id=estabelecimento_id, venda_id=venda.id, funcionario_id=funcionario_id,
+            cliente_id=cliente_id, codigo_temp=codigo_temp, itens_json=[], checkpoint_versao=1,
+            checkpoint_em=utcnow(),
+        )
+        db.session.add(carrinho)
+        db.session.flush()
+        return carrinho
+
+    @staticmethod
+    def obter(estabelecimento_id, venda_id):
+        """Carrinho da venda em andamento; recria do checkpoint se não houver linha."""
+        query = CarrinhoPdv.query.filter_by(venda_id=venda_id)
+        if str(estabelecimento_id).lower() != "all":
+            query = query.filter_by(estabelecimento_id=estabelecimento_id)
+        carrinho = query.first()
+        if carrinho is not None:
+            return carrinho
+        query = Venda.query.filter_by(id=venda_id, status="em_andamento")
+        if str(estabelecimento_id).lower() != "all":
+            query = query.filter_by(estabelecimento_id=estabelecimento_id)
+        venda = query.first()
+        return CarrinhoService._do_checkpoint(venda) if venda else None
+
+    @staticmethod
+    def _do_checkpoint(venda):
+        itens = [{
+            "produto_id": i.produto_id, "nome": i.produto_nome, "codigo": i.produto_codigo,
+            "unidade": i.produto_unidade, "quantidade": float(i.quantidade),
+            "preco_unitario": float(i.preco_unitario), "total_item": float(i.total_item),
+        } for i in venda.itens]
+        totais = _totais(itens, venda.desconto)
+        carrinho = CarrinhoPdv(
+            estabelecimento_id=venda.estabelecimento_id, venda_id=venda.id, funcionario_id=venda.funcionario_id,
+            cliente_id=venda.cliente_id, codigo_temp=venda.codigo, itens_json=itens, desconto=venda.desconto or 0,
+            checkpoint_versao=1, checkpoint_em=utcnow(), **totais,
+        )
+        db.session.add(carrinho)
+        db.session.flush()
+        logger.info("Carrinho da venda %s recuperado do checkpoint (%s itens)", venda.id, len(itens))
+        return carrinho
+
+    @staticmethod
+    def recuperar(estabelecimento_id, funcionario_id=None):
+        """Carrinhos abertos (retomada após queda do terminal), mais recentes primeiro."""
+        orfas = (Venda.query
+                 .outerjoin(CarrinhoPdv, CarrinhoPdv.venda_id == Venda.id)
+                 .filter(Venda.estabelecimento_id == estabelecimento_id, Venda.status == "em_andamento",
+                         CarrinhoPdv.id.is_(None))
+                 .all())
+        for venda in orfas:
+            CarrinhoService._do_checkpoint(venda)
+        query = CarrinhoPdv.query.filter_by(estabelecimento_id=estabelecimento_id, status="aberto")
+        if funcionario_id:
+            query = query.filter_by(funcionario_id=funcionario_id)
+        return query.order_by(CarrinhoPdv.atualizado_em.desc()).all()
+
+    @staticmethod
+    def _produto_da_operacao(carrinho, op):
+        """produto_id explícito, ou item_id legado: id do VendaItem gravado no checkpoint.
+        Um item_id nunca é tratado como produto — item inexistente é 404."""
+        try:
+            if op.get("produto_id") is not None:
+                return int(op["produto_id"])
+            item_id = int(op["item_id"]) if op.get("item_id") is not None else None
+        except (TypeError, ValueError):
+            raise CarrinhoErro("Identificador de produto/item inválido")
+        if item_id is None:
+            raise CarrinhoErro("Produto é obrigatório")
+        item = VendaItem.query.filter_by(id=item_id, venda_id=carrinho.venda_id).first()
+        if item is None:
+            raise CarrinhoErro("Item não encontrado", 404)
+        return item.produto_id
+
+    @staticmethod
+    def _novos_itens(carrinho, operacoes):
+        itens = {l["produto_id"]: dict(l) for l in carrinho.itens_json or []}
+        alvos = [(op.get("tipo") or "adicionar", CarrinhoService._produto_da_operacao(carrinho, op), op)
+                 for op in operacoes]
+        ids = {pid for tipo, pid, _ in alvos if tipo != "remover"}
+        produtos = {}
+        if ids:
+            produtos = {p.id: p for p in Produto.query.filter(
+                Produto.estabelecimento_id == carrinho.estabelecimento_id, Produto.id.in_(ids))}
+
+        for tipo, pid, op in alvos:
+            if tipo not in _OPERACOES:
+                raise CarrinhoErro(f"Operação inválida: {tipo}")
+            if tipo == "remover":
+                if itens.pop(pid, None) is None:
+                    raise CarrinhoErro("Item não encontrado", 404)
+                continue
+            produto = produtos.get(pid)
+            if produto is None:
+                raise CarrinhoErro(f"Produto {pid} não encontrado", 404)
+            quantidade = _dec(op.get("quantidade", 1))
+            if quantidade <= 0:
+                raise CarrinhoErro("Quantidade deve ser maior que 0")
+            linha = itens.get(pid) or {
+                "produto_id": pid, "nome": produto.nome, "codigo": produto.codigo_barras,
+                "unidade": produto.unidade_medida, "quantidade": 0, "preco_unitario": float(produto.preco_venda),
+            }
+            nova = _dec(linha["quantidade"]) + quantidade if tipo == "adicionar" else quantidade
+            if _dec(produto.quantidade) < nova:
+                raise CarrinhoErro(f"Estoque insuficiente para {produto.nome}. Disponível: {produto.quantidade}")
+            linha["quantidade"] = float(nova)
+            linha["total_item"] = float(round(nova * _dec(linha["preco_unitario"]), 2))
+            itens[pid] = linha
+        return list(itens.values())
+
+    @staticmethod
+    def _gravar(carrinho, valores: dict, condicao_versao=True) -> bool:
+        """UPDATE condicional na versão em memória; sincroniza o objeto se gravou."""
+        tabela = CarrinhoPdv.__table__
+        stmt = tabela.update().where(tabela.c.id == carrinho.id, tabela.c.status == "aberto")
+        if condicao_versao:
+            stmt = stmt.where(tabela.c.versao == carrinho.versao)
+        valores = {"atualizado_em": utcnow(), **valores}
+        if db.session.execute(stmt.values(**valores)).rowcount != 1:
+            return False
+        for campo, valor in valores.items():
+            set_committed_value(carrinho, campo, valor)
+        return True
+
+    @staticmethod
+    def aplicar(carrinho, operacoes, versao_esperada=None):
+        """Aplica o lote de operações numa nova versão do carrinho.
+
+        Com ``versao_esperada`` a gravação falha (CarrinhoConflito) se outro
+        terminal gravou antes; sem ela, o lote é reaplicado sobre o estado
+        relido, até _TENTATIVAS vezes."""
+        if not operacoes:
+            raise CarrinhoErro("Nenhuma operação informada")
+        for _ in range(_TENTATIVAS):
+            if carrinho.status != "aberto":
+                raise CarrinhoErro("Carrinho já encerrado", 409)
+            if versao_esperada is not None and int(versao_esperada) != carrinho.versao:
+                raise CarrinhoConflito(carrinho)
+            itens = CarrinhoService._novos_itens(carrinho, operacoes)
+            valores = {"itens_json": itens, "versao": carrinho.versao + 1, **_totais(itens, carrinho.desconto)}
+            if CarrinhoService._gravar(carrinho, valores):
+                break
+            db.session.refresh(carrinho)
+        else:
+            raise CarrinhoConflito(carrinho)
+
+        atrasado = carrinho.checkpoint_em is None or utcnow() - carrinho.checkpoint_em >= timedelta(
+            seconds=CHECKPOINT_SEGUNDOS)
+        if carrinho.versao - carrinho.checkpoint_versao >= CHECKPOINT_OPERACOES or atrasado:
+            CarrinhoService.checkpoint(carrinho)
+        return carrinho
+
+    @staticmethod
+    def checkpoint(carrinho):
+        """Grava o estado atual do carrinho em Venda/VendaItem (em andamento)."""
+        venda = Venda.query.filter_by(id=carrinho.venda_id, status="em_andamento").first()
+        if venda is None:
+            return
+        linhas = {l["produto_id"]: l for l in carrinho.itens_json or []}
+        for item in list(venda.itens):
+            linha = linhas.pop(item.produto_id, None)
+            if linha is None:
+                venda.itens.remove(item)
+            elif _dec(item.quantidade) != _dec(linha["quantidade"]):
+                item.quantidade = linha["quantidade"]
+                item.total_item = linha["total_item"]
+        for linha in linhas.values():
+            venda.itens.append(VendaItem(
+                estabelecimento_id=carrinho.estabelecimento_id, produto_id=linha["produto_id"],
+                produto_nome=linha["nome"], produto_codigo=linha["codigo"], produto_unidade=linha["unidade"],
+                quantidade=linha["quantidade"], preco_unitario=linha["preco_unitario"],
+                total_item=linha["total_item"], desconto=0,
+            ))
+        venda.cliente_id = carrinho.cliente_id
+        venda.subtotal = carrinho.subtotal
+        venda.desconto = carrinho.desconto
+        venda.total = carrinho.total
+        venda.quantidade_itens = int(carrinho.quantidade_itens or 0)
+        CarrinhoService._gravar(carrinho, {"checkpoint_versao": carrinho.versao, "checkpoint_em": utcnow()},
+                                condicao_versao=False)
+
+    @staticmethod
+    def itens_para_venda(carrinho):
+        """Itens no formato do payload de /api/pdv/finalizar."""
+        return [{"produto_id": l["produto_id"], "quantidade": l["quantidade"], "preco_unitario": l["preco_unitario"]}
+                for l in carrinho.itens_json or []]
+
+    @staticmethod
+    def encerrar(carrinho, venda_final_id):
+        """Marca o carrinho finalizado (na versão lida) e descarta a venda em andamento."""
+        venda_id = carrinho.venda_id
+        if not CarrinhoService._gravar(carrinho, {"status": "finalizado", "venda_final_id": venda_final_id,
+                                                  "venda_id": None}):
+            db.session.refresh(carrinho)
+            raise CarrinhoConflito(carrinho)
+        venda = Venda.query.filter_by(id=venda_id, status="em_andamento").first()
+        if venda is not None:
+            db.session.delete(venda)
+
+    @staticmethod
+    def serializar(carrinho) -> dict:
+        return {
+            "venda_id": carrinho.venda_id,
+            "codigo_temp": carrinho.codigo_temp,
+            "versao": carrinho.versao,
+            "status": carrinho.status,
+            "funcionario_id": carrinho.funcionario_id,
+            "cliente_id": carrinho.cliente_id,
+            "itens": carrinho.itens_json or [],
+            "subtotal": float(carrinho.subtotal or 0),
+            "desconto": float(carrinho.desconto or 0),
+            "total": float(carrinho.total or 0),
+            "quantidade_itens": float(carrinho.quantidade_itens or 0),
+            "checkpoint_versao": carrinho.checkpoint_versao,
+            "iniciada_em": carrinho.criado_em.isoformat() if carrinho.criado_em else None,
+            "atualizado_em": carrinho.atualizado_em.isoformat() if carrinho.atualizado_em else None,
+        }
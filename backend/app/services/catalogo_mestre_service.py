@@ -6,13 +6,204 @@ ou importação de XML de NF-e), tenta registrar o item no catálogo global se
 ele ainda não existir. Nunca sobrescreve um item já catalogado (a Cosmos ou
 outro tenant podem ter dados melhores) e nunca deixa erro vazar pro fluxo do
 tenant que originou o cadastro.
+
+Também concentra a leitura do catálogo: `buscar_ean`/`buscar_eans` passam
+pelo cache da aplicação (SimpleCache no processo ou Redis compartilhado, o
+mesmo `cache` do resto do app) antes do banco, com entradas negativas — EANs
+que a Cosmos já disse não conhecer não voltam à rede por algumas horas. As
+checagens de existência para importações em massa são um SELECT ... IN por
+lote, nunca um por produto.
 """
+import json
 import logging
+import os
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+from flask import current_app
 
 from app.models import db, CatalogoMestre
 
 logger = logging.getLogger(__name__)
 
+COSMOS_URL_PADRAO = "https://api.cosmos.bluesoft.com.br/gtins/{gtin}.json"
+_TTL_ENCONTRADO = 24 * 3600
+_TTL_AUSENTE = 6 * 3600  # 404 da Cosmos: só em cache (o catálogo não grava), expira
+_LOTE_IN = 500
+
+# Status de entrada só de cache: a Cosmos respondeu 404 para o EAN
+AUSENTE = "ausente"
+
+
+def _chave(ean: str) -> str:
+    return f"catalogo:ean:{ean}"
+
+
+def _cache():
+    from app import cache
+    return cache
+
+
+def _lotes(itens: List[str], tamanho: int = _LOTE_IN):
+    for i in range(0, len(itens), tamanho):
+        yield itens[i:i + tamanho]
+
+
+def buscar_eans(eans: Iterable[str]) -> Dict[str, dict]:
+    """Entradas do catálogo para os EANs dados: {ean: dict} (to_dict, ou
+    {"ean", "status": AUSENTE} para 404 recente da Cosmos). EANs que o
+    catálogo não conhece ficam fora do resultado.
+
+    Cache primeiro (get_many); o que faltar sai de um SELECT ... IN por lote."""
+    eans = list(dict.fromkeys(e for e in eans if e))
+    if not eans:
+        return {}
+    cache = _cache()
+    resultado: Dict[str, dict] = {}
+    try:
+        for ean, valor in zip(eans, cache.get_many(*[_chave(e) for e in eans])):
+            if valor:
+                resultado[ean] = valor
+    except Exception as e:
+        logger.warning(f"Catálogo Mestre: cache indisponível ({e})")
+
+    faltando = [e for e in eans if e not in resultado]
+    novos = {}
+    for lote in _lotes(faltando):
+        for item in db.session.execute(
+            db.select(CatalogoMestre).where(CatalogoMestre.ean.in_(lote))
+        ).scalars():
+            resultado[item.ean] = novos[_chave(item.ean)] = item.to_dict()
+    if novos:
+        try:
+            cache.set_many(novos, timeout=_TTL_ENCONTRADO)
+        except Exception as e:
+            logger.warning(f"Catálogo Mestre: cache indisponível ({e})")
+    return resultado
+
+
+def buscar_ean(ean: str) -> Optional[dict]:
+    return buscar_eans([ean]).get(ean)
+
+
+def eans_conhecidos(eans: Iterable[str]) -> set:
+    """EANs que o catálogo já tem (encontrados ou 404 registrado): para pular
+    na coleta e nas importações em massa, sem consultar um a um."""
+    eans = list(dict.fromkeys(e for e in eans if e))
+    conhecidos = set()
+    for lote in _lotes(eans):
+        conhecidos.update(db.session.execute(
+            db.select(CatalogoMestre.ean).where(CatalogoMestre.ean.in_(lote))
+        ).scalars())
+    return conhecidos
+
+
+def lembrar(*itens) -> None:
+    """Atualiza o cache com itens recém-gravados (CatalogoMestre ou to_dict();
+    chamar após o commit)."""
+    if not itens:
+        return
+    try:
+        dados = [i if isinstance(i, dict) else i.to_dict() for i in itens]
+        _cache().set_many({_chave(d["ean"]): d for d in dados}, timeout=_TTL_ENCONTRADO)
+    except Exception as e:
+        logger.warning(f"Catálogo Mestre: cache indisponível ({e})")
+
+
+def lembrar_ausente(ean: str) -> None:
+    try:
+        _cache().set(_chave(ean), {"ean": ean, "status": AUSENTE}, timeout=_TTL_AUSENTE)
+    except Exception as e:
+        logger.warning(f"Catálogo Mestre: cache indisponível ({e})")
+
+
+def esquecer(eans: Iterable[str]) -> None:
+    try:
+        _cache().delete_many(*[_chave(e) for e in eans])
+    except Exception as e:
+        logger.warning(f"Catálogo Mestre: cache indisponível ({e})")
+
+
+# ==================== COSMOS ====================
+
+def cosmos_url() -> str:
+    try:
+        url = current_app.config.get("COSMOS_URL")
+    except RuntimeError:
+        url = None
+    return url or os.environ.get("COSMOS_URL") or COSMOS_URL_PADRAO
+
+
+def cosmos_headers(user_agent: str = "Cosmos-API-Request") -> dict:
+    token = os.environ.get("COSMOS_TOKEN") or "MVsiut1dwhg12WGhPuTD9Q"
+    return {"X-Cosmos-Token": token, "Content-Type": "application/json", "User-Agent": user_agent}
+
+
+def consultar_cosmos(ean: str, sessao=None, timeout: int = 10,
+                     url: Optional[str] = None) -> Tuple[int, Optional[dict], dict]:
+    """Uma consulta à Cosmos. Retorna (http_status, json|None, headers).
+    Exceções de rede (requests.RequestException) sobem para o chamador.
+    Fora do app context (threads da coleta), passar `url` já resolvida."""
+    cliente = sessao or requests
+    resp = cliente.get((url or cosmos_url()).format(gtin=ean), headers=cosmos_headers(), timeout=timeout)
+    if resp.status_code == 200:
+        return 200, resp.json(), getattr(resp, "headers", {}) or {}
+    return resp.status_code, None, getattr(resp, "headers", {}) or {}
+
+
+def _decimal(v) -> Optional[Decimal]:
+    try:
+        return Decimal(str(v)) if v not in (None, "", 0, "0") else None
+    except (InvalidOperation, TypeError):
+        return None
+
+
+def dados_cosmos(ean: str, j: dict) -> dict:
+    """Campos do CatalogoMestre a partir do JSON da Cosmos (best-effort)."""
+    def _obj(chave):
+        v = j.get(chave)
+        return v if isinstance(v, dict) else {}
+    brand, ncm, cat, gpc = _obj("brand"), _obj("ncm"), _obj("category"), _obj("gpc")
+    return {
+        "ean": ean,
+        "nome": j.get("description") or j.get("title") or None,
+        "marca": brand.get("name") or None,
+        "fabricante": brand.get("name") or None,
+        "ncm": (ncm.get("code") or "")[:8] or None,
+        "categoria": cat.get("name") or gpc.get("description") or None,
+        "imagem_url": j.get("thumbnail") or None,
+        "preco_referencia": _decimal(j.get("avg_price") or j.get("price") or j.get("max_price")),
+    }
+
+
+def gravar_cosmos(ean: str, j: dict, novo: bool = False) -> CatalogoMestre:
+    """Upsert do item a partir da resposta da Cosmos (novo=True: o chamador já
+    sabe que o EAN não está no catálogo). Não commita; após o commit, chamar
+    lembrar(item)."""
+    item = None if novo else db.session.execute(
+        db.select(CatalogoMestre).where(CatalogoMestre.ean == ean)
+    ).scalar()
+    if item is None:
+        item = CatalogoMestre(ean=ean)
+        db.session.add(item)
+    for campo, valor in dados_cosmos(ean, j).items():
+        if valor is not None:
+            setattr(item, campo, valor)
+    item.fonte = "cosmos"
+    item.status = "encontrado"
+    item.payload_json = json.dumps(j, ensure_ascii=False)[:60000]
+    item.consultado_em = datetime.utcnow()
+    return item
+
+
+def gravar_nao_encontrado(ean: str) -> CatalogoMestre:
+    """Registra o 404 da Cosmos no catálogo (a coleta nunca reconsulta). Não commita."""
+    item = CatalogoMestre(ean=ean, fonte="cosmos", status="nao_encontrado", consultado_em=datetime.utcnow())
+    db.session.add(item)
+    return item
+
 
 def _ean_valido(codigo: str) -> bool:
     if not codigo:
@@ -27,7 +218,8 @@ def registrar_produto_se_novo(produto, estabelecimento, via: str) -> None:
         ean = (produto.codigo_barras or "").strip()
         if not _ean_valido(ean):
             return
-        if CatalogoMestre.query.filter_by(ean=ean).first():
+        entrada = buscar_ean(ean)
+        if entrada and (entrada["status"] != AUSENTE or eans_conhecidos([ean])):
             return
 
         categoria_nome = produto.categoria.nome if produto.categoria else None
@@ -45,5 +237,44 @@ def registrar_produto_se_novo(produto, estabelecimento, via: str) -> None:
             descoberto_por_estabelecimento_id=estabelecimento.id if estabelecimento else None,
             descoberto_via=via,
         ))
+        esquecer([ean])  # derruba um eventual 404 da Cosmos em cache
     except Exception as e:
         logger.warning(f"Catálogo Mestre: falha ao registrar produto (via={via}): {e}")
+
+
+def registrar_produtos_se_novos(produtos, estabelecimento, via: str) -> int:
+    """Versão em lote de registrar_produto_se_novo: um único SELECT ... IN para
+    saber quais EANs o catálogo já tem. Retorna quantos itens foram catalogados."""
+    try:
+        candidatos = {}
+        for produto in produtos:
+            ean = (produto.codigo_barras or "").strip()
+            if _ean_valido(ean) and ean not in candidatos:
+                candidatos[ean] = produto
+        if not candidatos:
+            return 0
+        existentes = eans_conhecidos(candidatos)
+
+        novos = [
+            CatalogoMestre(
+                ean=ean,
+                nome=produto.nome,
+                marca=produto.marca,
+                fabricante=produto.fabricante,
+                ncm=produto.ncm,
+                categoria=produto.categoria.nome if produto.categoria else None,
+                unidade=produto.unidade_medida,
+                imagem_url=produto.imagem_url,
+                fonte="tenant",
+                status="encontrado",
+                descoberto_por_estabelecimento_id=estabelecimento.id if estabelecimento else None,
+                descoberto_via=via,
+            )
+            for ean, produto in candidatos.items() if ean not in existentes
+        ]
+        db.session.add_all(novos)
+        esquecer([n.ean for n in novos])
+        return len(novos)
+    except Exception as e:
+        logger.warning(f"Catálogo Mestre: falha ao registrar produtos em lote (via={via}): {e}")
+        return 0
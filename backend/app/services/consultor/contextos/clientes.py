@@ -1,5 +1,6 @@
 from app.models import Cliente, db
 from sqlalchemy import desc
+from app.services.rfm_service import RFMService
 
 def montar_contexto(estabelecimento_id: int, is_manager: bool = True) -> dict:
     """Monta o contexto de Clientes (CRM) para o consultor IA.
@@ -36,7 +37,17 @@ def montar_contexto(estabelecimento_id: int, is_manager: bool = True) -> dict:
         for c in top_devedores
     ]
     
-    # 3. Resumo RFM Simples (quantidades)
+    # 3. Resumo RFM (segmentos pré-calculados em clientes_rfm)
     contexto["total_clientes_ativos"] = q.count()
+    contexto["segmentos_rfm"] = RFMService.contar_segmentos(estabelecimento_id)
+    contexto["clientes_em_risco"] = [
+        {
+            "nome": c["nome"],
+            "segmento": c["segmento"],
+            "dias_sem_comprar": c["recency_days"],
+            "valor_gasto_janela": c["monetary"],
+        }
+        for c in RFMService.obter_clientes_em_risco(estabelecimento_id, limite=10)
+    ]
 
     return contexto
@@ -0,0 +1,99 @@
+"""
+Servidor HTTP local que imita a API Cosmos (GET /gtins/<ean>.json).
+
+Usado nos testes do catálogo mestre e da coleta em massa: responde 200 com o
+JSON cadastrado em `produtos`, 404 para EANs desconhecidos e 429 (com
+Retry-After opcional) depois de `quota` requisições — ou nas
+`rejeitar_primeiras` requisições, para simular um limite por segundo. Conta as requisições e o
+pico de requisições simultâneas, o que permite verificar cache e concorrência.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):  # silencia o log padrão do http.server
+        pass
+
+    def _responder(self, status: int, corpo: Optional[Dict[str, Any]] = None, headers: Dict[str, str] = None):
+        dados = json.dumps(corpo or {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        for chave, valor in (headers or {}).items():
+            self.send_header(chave, valor)
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self):
+        fake: "FakeCosmos" = self.server.fake
+        with fake._lock:
+            fake.requisicoes.append(self.path)
+            fake._em_voo += 1
+            fake.pico_concorrencia = max(fake.pico_concorrencia, fake._em_voo)
+            n = len(fake.requisicoes)
+            estourou = n <= fake.rejeitar_primeiras or (fake.quota is not None and n > fake.quota)
+        try:
+            if fake.atraso:
+                time.sleep(fake.atraso)
+            if estourou:
+                headers = {"Retry-After": str(fake.retry_after)} if fake.retry_after is not None else {}
+                return self._responder(429, {"message": "Too Many Requests"}, headers)
+            ean = self.path.rsplit("/", 1)[-1].split(".", 1)[0]
+            if self.headers.get("X-Cosmos-Token") is None:
+                return self._responder(401, {"message": "token ausente"})
+            if ean in fake.produtos:
+                return self._responder(200, fake.produtos[ean])
+            return self._responder(404, {"message": "GTIN não encontrado"})
+        finally:
+            with fake._lock:
+                fake._em_voo -= 1
+
+
+class FakeCosmos:
+    """Uso: `with FakeCosmos({"789...": {...}}) as fake: app.config["COSMOS_URL"] = fake.url`."""
+
+    def __init__(self, produtos: Optional[Dict[str, Dict[str, Any]]] = None, quota: Optional[int] = None,
+                 retry_after: Optional[float] = None, atraso: float = 0.0, rejeitar_primeiras: int = 0):
+        self.produtos = dict(produtos or {})
+        self.quota = quota
+        self.rejeitar_primeiras = rejeitar_primeiras
+        self.retry_after = retry_after
+        self.atraso = atraso
+        self.requisicoes: List[str] = []
+        self.pico_concorrencia = 0
+        self._em_voo = 0
+        self._lock = threading.Lock()
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._servidor.daemon_threads = True
+        self._servidor.fake = self
+        self._thread = None
+
+    @property
+    def porta(self) -> int:
+        return self._servidor.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.porta}/gtins/{{gtin}}.json"
+
+    def iniciar(self) -> "FakeCosmos":
+        self._thread = threading.Thread(target=self._servidor.serve_forever, name="fake-cosmos", daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self) -> None:
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self) -> "FakeCosmos":
+        return self.iniciar()
+
+    def __exit__(self, *exc) -> None:
+        self.parar()
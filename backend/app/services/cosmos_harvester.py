@@ -0,0 +1,230 @@
+"""
+Coleta em massa da API Cosmos para o catálogo mestre.
+
+- Candidatos: EANs que as lojas vendem e o catálogo ainda não tem
+  (`candidatos_dos_tenants`, um anti-join no banco) ou uma lista externa —
+  nunca o catálogo inteiro carregado em memória.
+- Consultas concorrentes (threads com requests.Session keep-alive) limitadas
+  por um balde de fichas (`BaldeDeFichas`): no máximo `taxa_por_seg` chamadas
+  por segundo, com rajada curta. 429 com Retry-After curto pausa o balde e
+  devolve o EAN à fila; 429 sem ele (quota diária) encerra a coleta.
+- Resultados gravados em lote na thread principal (encontrado /
+  nao_encontrado), com checkpoint em arquivo a cada lote: uma coleta
+  interrompida (429, queda, Ctrl+C) retoma os pendentes e a contagem de
+  chamadas do dia de onde parou.
+
+Uso: scripts/cosmos_daily_harvest.py.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional
+
+import requests
+from sqlalchemy import exists, select
+
+from app.models import db, CatalogoMestre, Produto
+from app.services import catalogo_mestre_service as catalogo
+
+logger = logging.getLogger(__name__)
+
+_RETRY_AFTER_MAX = 120.0  # acima disso o 429 é tratado como quota do dia esgotada
+
+
+class BaldeDeFichas:
+    """Token bucket thread-safe: `retirar` bloqueia até haver ficha (ou `parar`)."""
+
+    def __init__(self, taxa_por_seg: float, capacidade: int = 1):
+        self.taxa = float(taxa_por_seg)
+        self.capacidade = max(1, int(capacidade))
+        self._fichas = float(self.capacidade)
+        self._ultimo = time.monotonic()
+        self._pausa_ate = 0.0
+        self._lock = threading.Lock()
+
+    def retirar(self, parar: Optional[threading.Event] = None) -> bool:
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                if agora >= self._pausa_ate:
+                    self._fichas = min(self.capacidade, self._fichas + (agora - self._ultimo) * self.taxa)
+                    self._ultimo = agora
+                    if self._fichas >= 1:
+                        self._fichas -= 1
+                        return True
+                    espera = (1 - self._fichas) / self.taxa
+                else:
+                    espera = self._pausa_ate - agora
+            if parar is not None and parar.wait(min(espera, 0.5)):
+                return False
+            if parar is None:
+                time.sleep(espera)
+
+    def pausar(self, segundos: float) -> None:
+        """Retry-After: ninguém retira ficha até passar o intervalo."""
+        with self._lock:
+            self._pausa_ate = max(self._pausa_ate, time.monotonic() + segundos)
+            self._fichas = 0.0
+            self._ultimo = self._pausa_ate
+
+
+class Checkpoint:
+    """Estado da coleta do dia em JSON (gravação atômica)."""
+
+    def __init__(self, caminho: Optional[str]):
+        self.caminho = caminho
+
+    def carregar(self) -> Dict[str, Any]:
+        hoje = date.today().isoformat()
+        if self.caminho and os.path.exists(self.caminho):
+            try:
+                with open(self.caminho, encoding="utf-8") as f:
+                    estado = json.load(f)
+                if estado.get("dia") == hoje:
+                    return estado
+                # Outro dia: a quota zerou, mas os pendentes continuam valendo
+                return {"dia": hoje, "chamadas": 0, "pendentes": estado.get("pendentes", [])}
+            except (OSError, ValueError) as e:
+                logger.warning(f"[HARVEST] Checkpoint ilegível ({e}); começando do zero.")
+        return {"dia": hoje, "chamadas": 0, "pendentes": []}
+
+    def salvar(self, estado: Dict[str, Any]) -> None:
+        if not self.caminho:
+            return
+        temporario = f"{self.caminho}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(estado, f)
+        os.replace(temporario, self.caminho)
+
+
+def candidatos_dos_tenants(limite: int) -> List[str]:
+    """EANs válidos vendidos pelas lojas e ausentes do catálogo (anti-join no banco)."""
+    p = Produto.__table__
+    consulta = (
+        select(p.c.codigo_barras).distinct()
+        .where(p.c.codigo_barras.isnot(None), p.c.deleted_at.is_(None),
+               ~exists().where(CatalogoMestre.__table__.c.ean == p.c.codigo_barras))
+        .execution_options(yield_per=1000)
+    )
+    eans = []
+    for codigo in db.session.execute(consulta).scalars():
+        codigo = (codigo or "").strip()
+        if catalogo._ean_valido(codigo):
+            eans.append(codigo)
+            if len(eans) >= limite:
+                break
+    return eans
+
+
+class ColetaCosmos:
+
+    def __init__(self, limite: int, concorrencia: int = 4, taxa_por_seg: float = 2.0, rajada: int = 4,
+                 checkpoint: Optional[str] = None, lote_commit: int = 20):
+        self.limite = limite
+        self.concorrencia = max(1, concorrencia)
+        self.balde = BaldeDeFichas(taxa_por_seg, rajada)
+        self.checkpoint = Checkpoint(checkpoint)
+        self.lote_commit = max(1, lote_commit)
+        self._parar = threading.Event()
+        self._local = threading.local()
+
+    def _sessao(self) -> requests.Session:
+        if not hasattr(self._local, "sessao"):
+            self._local.sessao = requests.Session()
+        return self._local.sessao
+
+    def _consultar(self, ean: str, url: str):
+        if not self.balde.retirar(self._parar):
+            return ean, None, None, None
+        try:
+            status, j, headers = catalogo.consultar_cosmos(ean, sessao=self._sessao(), timeout=15, url=url)
+            return ean, status, j, None if status != 429 else headers
+        except requests.RequestException as e:
+            return ean, None, None, e
+
+    def executar(self, candidatos: Iterable[str] = ()) -> Dict[str, Any]:
+        """Consulta os pendentes do checkpoint + os candidatos novos até o limite do dia."""
+        estado = self.checkpoint.carregar()
+        fila = list(dict.fromkeys(list(estado["pendentes"]) + [e for e in candidatos if catalogo._ean_valido(e)]))
+        conhecidos = catalogo.eans_conhecidos(fila)
+        fila = [e for e in fila if e not in conhecidos]
+        cota = max(0, self.limite - estado["chamadas"])
+        resumo = {"chamadas": 0, "encontrados": 0, "nao_encontrados": 0, "adiados": 0, "interrompido": None}
+        url = catalogo.cosmos_url()
+        gravados: List[CatalogoMestre] = []
+
+        def _persistir():
+            db.session.flush()
+            dados = [i.to_dict() for i in gravados]  # antes do commit: sem refresh por item
+            db.session.commit()
+            catalogo.lembrar(*dados)
+            gravados.clear()
+            self.checkpoint.salvar({"dia": estado["dia"], "chamadas": estado["chamadas"],
+                                    "pendentes": [e for e in fila if e not in concluidos]})
+
+        concluidos: set = set()
+        proximos = iter(list(fila))
+        reenfileirar: List[str] = []
+        em_voo = {}
+        with ThreadPoolExecutor(max_workers=self.concorrencia, thread_name_prefix="cosmos") as executor:
+            def _agendar():
+                while len(em_voo) < self.concorrencia and not self._parar.is_set():
+                    if resumo["chamadas"] + len(em_voo) >= cota:
+                        return
+                    ean = reenfileirar.pop() if reenfileirar else next(proximos, None)
+                    if ean is None:
+                        return
+                    em_voo[executor.submit(self._consultar, ean, url)] = ean
+
+            _agendar()
+            while em_voo:
+                prontos, _ = wait(list(em_voo), return_when=FIRST_COMPLETED)
+                for futuro in prontos:
+                    em_voo.pop(futuro)
+                    ean, status, j, extra = futuro.result()
+                    if status is None:
+                        if extra is not None:  # erro de rede: fica pendente para a próxima coleta
+                            resumo["adiados"] += 1
+                            logger.warning(f"[HARVEST] {ean} erro de rede ({extra}); adiado.")
+                        continue
+                    resumo["chamadas"] += 1
+                    estado["chamadas"] += 1
+                    if status == 429:
+                        espera = _retry_after(extra)
+                        if espera is not None and espera <= _RETRY_AFTER_MAX:
+                            self.balde.pausar(espera)
+                            reenfileirar.append(ean)
+                        else:
+                            resumo["interrompido"] = "quota"
+                            self._parar.set()
+                        continue
+                    if status == 200 and j:
+                        gravados.append(catalogo.gravar_cosmos(ean, j, novo=True))
+                        resumo["encontrados"] += 1
+                    elif status == 404:
+                        gravados.append(catalogo.gravar_nao_encontrado(ean))
+                        resumo["nao_encontrados"] += 1
+                    else:
+                        resumo["adiados"] += 1  # 5xx etc.: tenta de novo noutra coleta
+                        continue
+                    concluidos.add(ean)
+                if len(gravados) >= self.lote_commit:
+                    _persistir()
+                _agendar()
+        _persistir()
+        resumo["pendentes"] = len(fila) - len(concluidos)
+        return resumo
+
+
+def _retry_after(headers) -> Optional[float]:
+    try:
+        valor = (headers or {}).get("Retry-After")
+        return float(valor) if valor is not None else None
+    except (TypeError, ValueError):
+        return None
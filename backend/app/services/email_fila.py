@@ -0,0 +1,460 @@
+"""
+Fila de e-mails de saída.
+
+Nenhuma rota fala com o servidor SMTP: `EmailFilaService.enfileirar` grava o
+e-mail já renderizado em emails_fila e volta na hora. Workers (EmailWorker)
+pegam os pendentes em lote e enviam por conexões SMTP persistentes de um pool
+(_PoolSMTP) — login uma vez, vários envios na mesma sessão, reconexão
+transparente se o servidor derrubar a conexão ociosa.
+
+Falha transitória (rede, 4xx, autenticação) reagenda com backoff exponencial;
+recusa definitiva (5xx do destinatário/conteúdo) ou o máximo de tentativas
+levam o e-mail para "falhou" (dead-letter), de onde `reenviar_falhos` (CLI
+`flask reprocessar-emails`) o devolve à fila.
+
+A logo de cada loja vira uma parte MIME cacheada por estabelecimento
+(invalidada quando a configuração muda), sem decodificar base64 a cada envio.
+
+E-mails com senha provisória (tipos em _TIPOS_SENSIVEIS) têm o corpo apagado
+assim que são entregues; `purgar` (workers, de hora em hora, e CLI
+`flask purgar-emails`) remove os enviados mais antigos que a retenção e apaga o
+corpo sensível que ainda tenha ficado na fila (dead-letter).
+
+Sem workers no processo (TESTING/EMAIL_WORKERS=0) o envio acontece em linha,
+logo após enfileirar — o mesmo comportamento de antes.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import smtplib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, func, or_, select
+
+from app.models import db, Configuracao, EmailFila, utcnow
+
+logger = logging.getLogger(__name__)
+
+_WORKERS = int(os.getenv("EMAIL_WORKERS", "1"))
+_CONEXOES = int(os.getenv("EMAIL_SMTP_CONEXOES", "2"))
+_MAX_TENTATIVAS = int(os.getenv("EMAIL_MAX_TENTATIVAS", "5"))
+_BACKOFF_BASE = float(os.getenv("EMAIL_BACKOFF_BASE_SEC", "30"))
+_BACKOFF_MAX = 3600.0
+_LEASE_SEC = 300
+_LOTE = int(os.getenv("EMAIL_LOTE", "50"))
+_POLL_SEC = 5.0
+_NOOP_APOS_SEC = 30.0  # conexão parada há mais que isso é testada antes de reutilizar
+_OCIOSA_SEC = 120.0  # e fechada depois disso
+_RETENCAO_DIAS = int(os.getenv("EMAIL_RETENCAO_DIAS", "30"))
+_PURGA_SEC = 3600.0
+_TIPOS_SENSIVEIS = frozenset({"credenciais", "onboarding"})  # corpo leva senha provisória
+
+_acordar = threading.Event()
+_workers: List["EmailWorker"] = []
+
+_config_smtp: Optional[Dict[str, Any]] = None
+_logos: Dict[Optional[int], tuple] = {}
+_logos_lock = threading.Lock()
+
+
+class ErroEnvioPermanente(Exception):
+    """Recusa definitiva do servidor (não adianta tentar de novo)."""
+
+
+def configuracao_smtp() -> Dict[str, Any]:
+    """Configuração SMTP resolvida uma vez por processo (config/env/arquivos .env)."""
+    global _config_smtp
+    if _config_smtp is None:
+        from app.services.email_service import _resolve_mail_setting
+
+        usuario = _resolve_mail_setting("MAIL_USERNAME")
+        _config_smtp = {
+            "servidor": _resolve_mail_setting("MAIL_SERVER", "smtp.gmail.com"),
+            "porta": int(_resolve_mail_setting("MAIL_PORT", 587)),
+            "usuario": usuario,
+            "senha": _resolve_mail_setting("MAIL_PASSWORD"),
+            "remetente": _resolve_mail_setting("MAIL_DEFAULT_SENDER", usuario),
+            "tls": _resolve_mail_setting("MAIL_USE_TLS", True),
+            "ssl": _resolve_mail_setting("MAIL_USE_SSL", False),
+        }
+    return _config_smtp
+
+
+def recarregar_configuracao() -> None:
+    """Descarta a configuração SMTP e as conexões abertas (após trocar credenciais)."""
+    global _config_smtp
+    _config_smtp = None
+    _pool.fechar_todas()
+
+
+def backoff(tentativas: int) -> float:
+    return min(_BACKOFF_MAX, _BACKOFF_BASE * (2 ** max(0, tentativas - 1)))
+
+
+class ConexaoSMTP:
+    """Uma sessão SMTP autenticada, reaproveitada entre envios."""
+
+    def __init__(self, cfg: Dict[str, Any]):
+        self.cfg = cfg
+        self._smtp: Optional[smtplib.SMTP] = None
+        self.ultimo_uso = 0.0
+
+    def _abrir(self) -> smtplib.SMTP:
+        cfg = self.cfg
+        if cfg["porta"] == 465 or cfg["ssl"]:
+            smtp = smtplib.SMTP_SSL(cfg["servidor"], cfg["porta"], context=ssl.create_default_context(), timeout=10)
+        else:
+            smtp = smtplib.SMTP(cfg["servidor"], cfg["porta"], timeout=10)
+            if cfg["tls"]:
+                smtp.starttls()
+        if cfg["usuario"] and cfg["senha"]:
+            smtp.login(cfg["usuario"], cfg["senha"])
+        return smtp
+
+    def _sessao(self) -> smtplib.SMTP:
+        if self._smtp is not None and time.monotonic() - self.ultimo_uso > _NOOP_APOS_SEC:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self.fechar()
+            except smtplib.SMTPException:
+                self.fechar()
+            except OSError:
+                self.fechar()
+        if self._smtp is None:
+            self._smtp = self._abrir()
+        return self._smtp
+
+    def enviar(self, msg) -> None:
+        try:
+            self._sessao().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Servidor fechou a sessão ociosa: reabre uma vez e reenvia
+            self.fechar()
+            self._sessao().send_message(msg)
+        self.ultimo_uso = time.monotonic()
+
+    def fechar(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+class _PoolSMTP:
+    """Pool limitado de conexões SMTP compartilhado pelos workers do processo."""
+
+    def __init__(self, tamanho: int):
+        self._livres: List[ConexaoSMTP] = []
+        self._lock = threading.Lock()
+        self._vagas = threading.BoundedSemaphore(max(1, tamanho))
+
+    @contextmanager
+    def emprestar(self, cfg: Dict[str, Any]):
+        self._vagas.acquire()
+        with self._lock:
+            con = self._livres.pop() if self._livres else None
+        if con is None or con.cfg is not cfg:
+            if con is not None:
+                con.fechar()
+            con = ConexaoSMTP(cfg)
+        try:
+            yield con
+        except Exception:
+            con.fechar()
+            raise
+        finally:
+            with self._lock:
+                self._livres.append(con)
+            self._vagas.release()
+
+    def fechar_ociosas(self) -> None:
+        agora = time.monotonic()
+        with self._lock:
+            for con in self._livres:
+                if con.ultimo_uso and agora - con.ultimo_uso > _OCIOSA_SEC:
+                    con.fechar()
+
+    def fechar_todas(self) -> None:
+        with self._lock:
+            for con in self._livres:
+                con.fechar()
+            self._livres.clear()
+
+
+_pool = _PoolSMTP(_CONEXOES)
+
+
+def _logo(estab_id: Optional[int]):
+    """Parte MIME da logo da loja (ou a oficial), cacheada por estabelecimento.
+
+    O cache é validado pelo updated_at da Configuracao: trocar a logo invalida."""
+    from app.services.email_service import _get_official_logo_b64, _prepare_logo_cid
+
+    versao = None
+    if estab_id:
+        versao = db.session.execute(
+            select(Configuracao.updated_at).where(Configuracao.estabelecimento_id == estab_id)
+        ).scalar()
+    with _logos_lock:
+        cache = _logos.get(estab_id)
+    if cache and cache[0] == versao:
+        return cache[1]
+
+    parte = None
+    if estab_id:
+        b64 = db.session.execute(
+            select(Configuracao.logo_base64).where(Configuracao.estabelecimento_id == estab_id)
+        ).scalar()
+        parte, _ = _prepare_logo_cid(b64)
+    if parte is None:
+        with _logos_lock:
+            oficial = _logos.get(None)
+        if oficial is None:
+            oficial = (None, _prepare_logo_cid(_get_official_logo_b64())[0])
+            with _logos_lock:
+                _logos[None] = oficial
+        parte = oficial[1]
+    with _logos_lock:
+        _logos[estab_id] = (versao, parte)
+    return parte
+
+
+def _mensagem(email: Dict[str, Any], remetente: str):
+    msg = MIMEMultipart("related")
+    msg["Subject"] = email["assunto"]
+    msg["From"] = remetente
+    msg["To"] = email["destinatario"]
+    alternativa = MIMEMultipart("alternative")
+    msg.attach(alternativa)
+    alternativa.attach(MIMEText(email["corpo_texto"] or "", "plain", "utf-8"))
+    if email["corpo_html"]:
+        alternativa.attach(MIMEText(email["corpo_html"], "html", "utf-8"))
+    if email["com_logo"]:
+        parte = _logo(email["estabelecimento_id"])
+        if parte is not None:
+            msg.attach(parte)
+    return msg
+
+
+def _erro_de_sessao(erro: Exception) -> bool:
+    # SMTPException herda de OSError: só rede "pura" e falhas de conexão/login contam aqui
+    if isinstance(erro, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                         smtplib.SMTPAuthenticationError)):
+        return True
+    return isinstance(erro, OSError) and not isinstance(erro, smtplib.SMTPException)
+
+
+def _permanente(erro: Exception) -> bool:
+    if isinstance(erro, ErroEnvioPermanente):
+        return True
+    if isinstance(erro, smtplib.SMTPRecipientsRefused):
+        return all(500 <= codigo < 600 for codigo, _ in erro.recipients.values())
+    codigo = getattr(erro, "smtp_code", None)
+    return isinstance(erro, (smtplib.SMTPDataError, smtplib.SMTPSenderRefused)) and bool(codigo) and 500 <= codigo < 600
+
+
+class EmailFilaService:
+
+    @staticmethod
+    def ativa() -> bool:
+        """Há workers neste processo? Sem eles o envio acontece em linha."""
+        return any(w.is_alive() for w in _workers)
+
+    @staticmethod
+    def configurado() -> bool:
+        cfg = configuracao_smtp()
+        return bool(cfg["servidor"] and cfg["porta"] and cfg["usuario"] and cfg["senha"])
+
+    @staticmethod
+    def enfileirar(destinatario: str, assunto: str, corpo_texto: Optional[str] = None,
+                   corpo_html: Optional[str] = None, estabelecimento_id: Optional[int] = None,
+                   tipo: str = "generico", com_logo: bool = False) -> EmailFila:
+        """Grava o e-mail na fila e commita. Sem workers, envia em seguida (em linha)."""
+        email = EmailFila(
+            estabelecimento_id=estabelecimento_id, tipo=tipo, destinatario=destinatario.strip(),
+            assunto=assunto[:300], corpo_texto=corpo_texto, corpo_html=corpo_html,
+            com_logo=com_logo, status="pendente", proxima_tentativa_em=utcnow(),
+        )
+        db.session.add(email)
+        db.session.commit()
+        if EmailFilaService.ativa():
+            _acordar.set()
+        else:
+            EmailFilaService.processar_pendentes(ids=[email.id])
+            db.session.refresh(email)
+        return email
+
+    @staticmethod
+    def _reivindicar(limite: int, ids: Optional[Iterable[int]] = None) -> List[int]:
+        """Lease num UPDATE só: o lote some da fila enquanto é enviado (vale entre processos)."""
+        t = EmailFila.__table__
+        agora = utcnow()
+        vencidos = (t.c.status == "pendente",
+                    or_(t.c.proxima_tentativa_em.is_(None), t.c.proxima_tentativa_em <= agora))
+        if ids is None:
+            ids = db.session.execute(
+                select(t.c.id).where(*vencidos).order_by(t.c.proxima_tentativa_em, t.c.id).limit(limite)
+            ).scalars().all()
+        ids = list(ids)
+        if not ids:
+            return []
+        reivindicados = db.session.execute(
+            t.update().where(t.c.id.in_(ids), *vencidos)
+            .values(proxima_tentativa_em=agora + timedelta(seconds=_LEASE_SEC), tentativas=t.c.tentativas + 1)
+            .returning(t.c.id)
+        ).scalars().all()
+        db.session.commit()
+        return sorted(reivindicados)
+
+    @staticmethod
+    def processar_pendentes(limite: int = _LOTE, ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+        """Envia um lote de e-mails vencidos numa mesma sessão SMTP. Retorna contagem por status."""
+        reivindicados = EmailFilaService._reivindicar(limite, ids)
+        if not reivindicados:
+            return {}
+        t = EmailFila.__table__
+        emails = db.session.execute(
+            select(t.c.id, t.c.estabelecimento_id, t.c.tipo, t.c.destinatario, t.c.assunto, t.c.corpo_texto,
+                   t.c.corpo_html, t.c.com_logo, t.c.tentativas).where(t.c.id.in_(reivindicados)).order_by(t.c.id)
+        ).mappings().all()
+
+        cfg = configuracao_smtp()
+        agora = utcnow()
+        resultados: List[Dict[str, Any]] = []
+        try:
+            with _pool.emprestar(cfg) as con:
+                for email in emails:
+                    try:
+                        if not EmailFilaService.configurado():
+                            raise ErroEnvioPermanente("Credenciais SMTP não configuradas")
+                        con.enviar(_mensagem(email, cfg["remetente"]))
+                        resultados.append({"b_id": email["id"], "b_status": "enviado", "b_erro": None,
+                                           "b_enviado": utcnow(), "b_proxima": None})
+                    except Exception as e:
+                        if _erro_de_sessao(e):
+                            raise  # problema da sessão, não do e-mail: o resto do lote também falha
+                        resultados.append(EmailFilaService._falha(email, e, agora))
+        except Exception as e:
+            enviados = {r["b_id"] for r in resultados}
+            logger.error(f"[EMAIL] Sessão SMTP falhou ({cfg['servidor']}:{cfg['porta']}): {e}")
+            resultados.extend(EmailFilaService._falha(email, e, agora) for email in emails if email["id"] not in enviados)
+
+        db.session.execute(
+            t.update().where(t.c.id == bindparam("b_id")).values(
+                status=bindparam("b_status"), ultimo_erro=bindparam("b_erro"),
+                enviado_em=bindparam("b_enviado"), proxima_tentativa_em=bindparam("b_proxima"),
+            ),
+            resultados,
+        )
+        enviados = {r["b_id"] for r in resultados if r["b_status"] == "enviado"}
+        sensiveis = [e["id"] for e in emails if e["id"] in enviados and e["tipo"] in _TIPOS_SENSIVEIS]
+        if sensiveis:
+            db.session.execute(t.update().where(t.c.id.in_(sensiveis)).values(corpo_texto=None, corpo_html=None))
+        db.session.commit()
+        contagem: Dict[str, int] = {}
+        for r in resultados:
+            contagem[r["b_status"]] = contagem.get(r["b_status"], 0) + 1
+        return contagem
+
+    @staticmethod
+    def _falha(email, erro: Exception, agora) -> Dict[str, Any]:
+        definitivo = _permanente(erro) or email["tentativas"] >= _MAX_TENTATIVAS
+        if definitivo:
+            logger.warning(f"[EMAIL] {email['id']} para {email['destinatario']} foi para dead-letter: {erro}")
+        return {
+            "b_id": email["id"], "b_status": "falhou" if definitivo else "pendente",
+            "b_erro": str(erro)[:1000], "b_enviado": None,
+            "b_proxima": None if definitivo else agora + timedelta(seconds=backoff(email["tentativas"])),
+        }
+
+    @staticmethod
+    def reenviar_falhos(ids: Optional[Iterable[int]] = None) -> int:
+        """Devolve e-mails do dead-letter para a fila (todos, ou só os ids dados)."""
+        t = EmailFila.__table__
+        stmt = t.update().where(t.c.status == "falhou")
+        if ids is not None:
+            stmt = stmt.where(t.c.id.in_(list(ids)))
+        res = db.session.execute(stmt.values(status="pendente", tentativas=0, proxima_tentativa_em=utcnow()))
+        db.session.commit()
+        _acordar.set()
+        return res.rowcount
+
+    @staticmethod
+    def purgar(dias: int = _RETENCAO_DIAS) -> Dict[str, int]:
+        """Remove os enviados há mais de ``dias`` e apaga o corpo sensível que sobrou na fila."""
+        t = EmailFila.__table__
+        corte = utcnow() - timedelta(days=dias)
+        removidos = db.session.execute(
+            t.delete().where(t.c.status == "enviado", t.c.enviado_em < corte)
+        ).rowcount
+        apagados = db.session.execute(
+            t.update().where(t.c.tipo.in_(_TIPOS_SENSIVEIS), t.c.status != "pendente", t.c.criado_em < corte,
+                             or_(t.c.corpo_texto.isnot(None), t.c.corpo_html.isnot(None)))
+            .values(corpo_texto=None, corpo_html=None)
+        ).rowcount
+        db.session.commit()
+        return {"removidos": removidos, "corpos_apagados": apagados}
+
+    @staticmethod
+    def resumo(estabelecimento_id: Optional[int] = None) -> Dict[str, Any]:
+        t = EmailFila.__table__
+        filtro = [] if estabelecimento_id is None else [t.c.estabelecimento_id == estabelecimento_id]
+        por_status = dict(db.session.execute(
+            select(t.c.status, func.count(t.c.id)).where(*filtro).group_by(t.c.status)
+        ).all())
+        mais_antigo = db.session.execute(
+            select(func.min(t.c.criado_em)).where(t.c.status == "pendente", *filtro)
+        ).scalar()
+        return {
+            "pendente": por_status.get("pendente", 0),
+            "enviado": por_status.get("enviado", 0),
+            "falhou": por_status.get("falhou", 0),
+            "pendente_mais_antigo": mais_antigo.isoformat() if mais_antigo else None,
+        }
+
+
+class EmailWorker(threading.Thread):
+    def __init__(self, app, indice: int):
+        super().__init__(name=f"email-fila-{indice}")
+        self.app = app
+        self.daemon = True
+
+    def run(self):
+        ultima_purga = 0.0
+        while True:
+            _acordar.wait(timeout=_POLL_SEC)
+            _acordar.clear()
+            try:
+                with self.app.app_context():
+                    while EmailFilaService.processar_pendentes():
+                        pass
+                    if time.monotonic() - ultima_purga > _PURGA_SEC:
+                        ultima_purga = time.monotonic()
+                        EmailFilaService.purgar()
+            except Exception as e:
+                self.app.logger.error(f"[EMAIL] Erro no ciclo da fila: {e}")
+            _pool.fechar_ociosas()
+
+
+def start_email_fila(app):
+    """Inicia os workers da fila de e-mails. Retorna a lista de threads (vazia se desabilitado)."""
+    if app.config.get("TESTING") or _WORKERS <= 0:
+        app.logger.info("[EMAIL] Workers NÃO iniciados (desabilitado); e-mails enviados em linha.")
+        return []
+    if not _workers:
+        for i in range(_WORKERS):
+            worker = EmailWorker(app, i)
+            worker.start()
+            _workers.append(worker)
+        app.logger.info(f"[EMAIL] {_WORKERS} worker(s) da fila de e-mails iniciado(s).")
+    return list(_workers)
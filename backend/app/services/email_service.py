@@ -4,15 +4,10 @@ Serviço de envio de emails
 Cupons fiscais, notificações, etc.
 """
 
-from flask import current_app, render_template_string
+from flask import current_app
 from flask_mail import Message
 from app import mail
-from datetime import datetime
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import ssl
 
 
 def _format_moeda(valor) -> str:
@@ -74,6 +69,9 @@ def _resolve_mail_setting(key: str, default=None):
 
     val = None
     for k in msg_keys:
+        # False explícito na config vale (senão cairia no default True do TLS)
+        if isinstance(current_app.config.get(k), bool):
+            return current_app.config[k]
         val = (
             current_app.config.get(k)
             or os.environ.get(k)
@@ -163,47 +161,7 @@ def _get_official_logo_b64():
     return None
 
 
-def enviar_cupom_fiscal(venda_data: dict, cliente_email: str):
-    """
-    Envia cupom/comprovante por email usando smtplib direto.
-    """
-    try:
-        # Resolver configurações
-        mail_server = _resolve_mail_setting("MAIL_SERVER", "smtp.gmail.com")
-        mail_port = int(_resolve_mail_setting("MAIL_PORT", 587))
-        mail_username = _resolve_mail_setting("MAIL_USERNAME")
-        mail_password = _resolve_mail_setting("MAIL_PASSWORD")
-        mail_sender = _resolve_mail_setting("MAIL_DEFAULT_SENDER", mail_username)
-        mail_use_tls = _resolve_mail_setting("MAIL_USE_TLS", True)
-        mail_use_ssl = _resolve_mail_setting("MAIL_USE_SSL", False)
-
-        if not mail_server or not mail_port:
-            return False, "Configuração SMTP incompleta"
-        if not mail_username or not mail_password:
-            return False, "Credenciais SMTP não configuradas"
-
-        venda = venda_data.get("venda", {})
-        comprovante = venda_data.get("comprovante", {})
-        estabelecimento = venda_data.get("estabelecimento", {})
-
-        # Prioridade de Logo: 1. Logo Customizada do Estabelcimento (Base64) 2. Logo Oficial do Sistema
-        # Blindagem: Garantir que comece com data:image
-        logo_b64 = estabelecimento.get("logo_base64")
-        image_part, _ = _prepare_logo_cid(logo_b64)
-            
-        # Fallback: Se não tem logo customizada ou falhou no processamento, usa a oficial
-        if not image_part:
-            current_app.logger.info("Tentando fallback para logo oficial...")
-            logo_b64 = _get_official_logo_b64()
-            image_part, _ = _prepare_logo_cid(logo_b64)
-
-        # Simulação de dados fiscais (Elite Experience)
-        import random
-        chave_acesso = "".join([str(random.randint(0, 9)) for _ in range(44)])
-        protocolo = f"{random.randint(100000000, 999999999)}"
-        data_protocolo = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-
-        html_template = """
+_CUPOM_HTML = """
 <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
 <html xmlns="http://www.w3.org/1999/xhtml">
 <head>
@@ -376,87 +334,56 @@ def enviar_cupom_fiscal(venda_data: dict, cliente_email: str):
 </html>
 """
 
-        # 2. Preparar Logo CID (Já feito acima com fallback)
+_cupom_compilado = None
+
+
+def _cupom_template():
+    """Template do cupom compilado uma vez por processo (em vez de a cada e-mail)."""
+    global _cupom_compilado
+    if _cupom_compilado is None:
+        _cupom_compilado = current_app.jinja_env.from_string(_CUPOM_HTML)
+    return _cupom_compilado
+
 
-        html_content = render_template_string(
-            html_template,
+def enviar_cupom_fiscal(venda_data: dict, cliente_email: str, estabelecimento_id=None):
+    """
+    Renderiza o cupom/comprovante e coloca na fila de e-mails (email_fila).
+    O envio SMTP acontece no worker, fora da requisição; retorna (False, erro)
+    apenas quando o SMTP não está configurado.
+    """
+    from app.services.email_fila import EmailFilaService
+
+    try:
+        if not EmailFilaService.configurado():
+            return False, "Credenciais SMTP não configuradas"
+
+        venda = venda_data.get("venda", {})
+        comprovante = venda_data.get("comprovante", {})
+        estabelecimento = venda_data.get("estabelecimento", {})
+        estabelecimento_id = estabelecimento_id or venda_data.get("estabelecimento_id")
+
+        # A logo (da loja ou a oficial) vai como parte MIME cacheada por estabelecimento no worker
+        html_content = _cupom_template().render(
             venda=venda,
             comprovante=comprovante,
             estabelecimento=estabelecimento,
             fmt=_format_moeda,
-            has_logo=True if image_part else False
+            has_logo=True,
         )
-
-        # Simulação de envio com blindagem contra Erro 500
-        try:
-            # Configurar mensagem MIME
-            msg = MIMEMultipart("related")
-            msg["Subject"] = f"★ [Comprovante] {estabelecimento.get('nome_fantasia', 'Mercadinho')} - #{venda.get('codigo', '')}"
-            msg["From"] = mail_sender
-            msg["To"] = cliente_email
-            
-            msg_alternative = MIMEMultipart('alternative')
-            msg.attach(msg_alternative)
-
-            text_content = f"Comprovante {venda.get('codigo', '')} - Total: R$ {venda.get('total', '0.00')}"
-            
-            msg_alternative.attach(MIMEText(text_content, "plain"))
-            msg_alternative.attach(MIMEText(html_content, "html"))
-            
-            # Se tiver imagem para embedar (CID), anexa ao MIME principal (related)
-            # Ordem: alternative (text/html) -> image
-            if image_part:
-                msg.attach(image_part)
-                current_app.logger.info("📎 [EMAIL] Logo CID anexada com sucesso.")
-            else:
-                current_app.logger.warning("⚠️ [EMAIL] Nenhuma logo anexada (has_logo era False).")
-            
-            # Enviar email com timeout para evitar travamento da API
-            if mail_port == 465 or mail_use_ssl:
-                context = ssl.create_default_context()
-                with smtplib.SMTP_SSL(mail_server, mail_port, context=context, timeout=10) as server:
-                    server.login(mail_username, mail_password)
-                    server.send_message(msg)
-            else:
-                with smtplib.SMTP(mail_server, mail_port, timeout=10) as server:
-                    if mail_use_tls:
-                        server.starttls()
-                    server.login(mail_username, mail_password)
-                    server.send_message(msg)
-
-            current_app.logger.info(f"✅ Cupom enviado com sucesso para {cliente_email}")
-            return True, ""
-
-        except smtplib.SMTPException as smtp_err:
-            erro_msg = f"Rejeição do servidor de e-mail: {str(smtp_err)}"
-            current_app.logger.error(f"❌ SMTP Error: {erro_msg}")
-            return False, erro_msg
-        except Exception as generic_err:
-            erro_msg = f"Falha técnica no serviço de e-mail: {str(generic_err)}"
-            current_app.logger.error(f"❌ Email Delivery Error: {erro_msg}")
-            return False, erro_msg
-
-    except smtplib.SMTPAuthenticationError as e:
-        msg_erro = str(e)
-        if "535" in msg_erro or "Username and Password not accepted" in msg_erro:
-            detalhe = (
-                "Credenciais Gmail rejeitadas. "
-                "O Gmail exige App Password (senha de aplicativo), não a senha normal da conta. "
-                "Acesse: myaccount.google.com → Segurança → Senhas de app → Gere uma senha para 'Email'. "
-                "Atualize MAIL_PASSWORD no backend/mail.env com os 16 caracteres gerados (sem espaços)."
-            )
-        else:
-            detalhe = f"Erro de autenticação SMTP: {msg_erro}"
-        current_app.logger.error(f"❌ Erro de autenticação ao enviar cupom: {msg_erro}")
-        return False, detalhe
-
-    except smtplib.SMTPConnectError as e:
-        detalhe = f"Não foi possível conectar ao servidor SMTP ({mail_server}:{mail_port}). Verifique MAIL_SERVER e MAIL_PORT."
-        current_app.logger.error(f"❌ Erro de conexão SMTP: {str(e)}")
-        return False, detalhe
+        EmailFilaService.enfileirar(
+            destinatario=cliente_email,
+            assunto=f"★ [Comprovante] {estabelecimento.get('nome_fantasia', 'Mercadinho')} - #{venda.get('codigo', '')}",
+            corpo_texto=f"Comprovante {venda.get('codigo', '')} - Total: R$ {venda.get('total', '0.00')}",
+            corpo_html=html_content,
+            estabelecimento_id=estabelecimento_id,
+            tipo="cupom",
+            com_logo=True,
+        )
+        current_app.logger.info(f"✅ Cupom enfileirado para {cliente_email}")
+        return True, ""
 
     except Exception as e:
-        current_app.logger.error(f"❌ Erro ao enviar cupom: {str(e)}")
+        current_app.logger.error(f"❌ Erro ao enfileirar cupom: {str(e)}")
         return False, str(e)
 
 
@@ -489,8 +416,21 @@ def enviar_email(to, subject, template):
     """
     Função genérica de compatibilidade para envio de emails.
     O sistema antigo tenta importar isso.
+    Com SMTP configurado, vai pela fila de e-mails (envio fora da requisição).
     """
+    from app.services.email_fila import EmailFilaService
+
     try:
+        if EmailFilaService.configurado():
+            html = "<html" in template
+            EmailFilaService.enfileirar(
+                destinatario=to,
+                assunto=subject,
+                corpo_texto=None if html else template,
+                corpo_html=template if html else None,
+            )
+            return True
+
         msg = Message(
             subject=subject,
             sender=current_app.config.get(
@@ -512,6 +452,32 @@ def enviar_email(to, subject, template):
         return False
 
 
+def notificar_alertas_estoque(estabelecimento, alertas: list) -> bool:
+    """
+    Envia UM e-mail-resumo com os alertas de estoque/validade novos da loja
+    (em vez de um e-mail por produto).
+    """
+    if not alertas:
+        return False
+    linhas = "".join(
+        f"<tr><td>{a.get('nivel', '').upper()}</td><td>{a.get('produto_nome') or '-'}</td>"
+        f"<td>{a.get('mensagem', '')}</td></tr>"
+        for a in alertas
+    )
+    html = (
+        "<html><body>"
+        f"<h3>{len(alertas)} novo(s) alerta(s) de estoque - {estabelecimento.nome_fantasia}</h3>"
+        "<table border='1' cellpadding='4' cellspacing='0'>"
+        "<tr><th>Nível</th><th>Produto</th><th>Alerta</th></tr>"
+        f"{linhas}</table></body></html>"
+    )
+    return enviar_email(
+        estabelecimento.email,
+        f"[MercadinhoSys] {len(alertas)} alerta(s) de estoque",
+        html,
+    )
+
+
 # -- Merged from services/email_service.py --
 
 import logging
@@ -522,8 +488,18 @@ logger = logging.getLogger(__name__)
 class EmailService:
     """
     Serviço centralizado para envio de comunicações por e-mail.
-    Atualmente suporta simulação em log e preparação para SendGrid.
+    Com SMTP configurado, os e-mails vão pela fila (email_fila); sem ele,
+    seguem simulados em log.
     """
+
+    @staticmethod
+    def _enfileirar(to_email, subject, content, tipo):
+        from app.services.email_fila import EmailFilaService
+
+        if not EmailFilaService.configurado():
+            return False
+        EmailFilaService.enfileirar(to_email, subject, corpo_texto=content.strip(), tipo=tipo)
+        return True
     
     @staticmethod
     def send_welcome_email(to_email, nome_usuario):
@@ -546,8 +522,10 @@ class EmailService:
         Equipe MercadinhoSys
         """
         
-        # Simulação de envio (Iniciando infraestrutura)
-        # TODO: Integrar com SendGrid ou SMTP futuramente
+        if EmailService._enfileirar(to_email, subject, content, "boas_vindas"):
+            return True
+
+        # Sem SMTP configurado: simulação em log
         logger.info(f"📧 [EMAIL SIMULADO] Enviando para: {to_email}")
         logger.info(f"Subject: {subject}")
         logger.info(f"Body: {content[:100]}...")
@@ -586,10 +564,11 @@ class EmailService:
         Equipe Maldivas Sistemas
         """
         
+        if EmailService._enfileirar(to_email, subject, content, "credenciais"):
+            return True
+
         logger.info(f"📧 [EMAIL BOAS-VINDAS] Enviando para: {to_email}")
-        logger.info(f"Subject: {subject}")
-        # Log completo apenas em ambientes controlados por segurança
-        logger.info(f"Body: {content}")
+        logger.info(f"Subject: {subject}")  # corpo fora do log: leva a senha provisória
         
         return True
 
@@ -635,10 +614,12 @@ Atenciosamente,
 Equipe MercadinhoSys
         """
         
+        if EmailService._enfileirar(to_email, subject, content, "onboarding"):
+            return True
+
         logger.info(f"📧 [EMAIL ONBOARDING SaaS] Enviando para: {to_email}")
         logger.info(f"Estabelecimento: {nome_estabelecimento}")
         logger.info(f"Subject: {subject}")
-        logger.info(f"Body: {content[:200]}...")
         
         return True
 
@@ -0,0 +1,391 @@
+"""
+Motor de alertas de estoque e validade (ruptura, lote vencendo, lote vencido,
+produto parado).
+
+Uma passada set-based e multi-tenant: uma consulta sobre produtos, uma sobre
+produto_lotes (+ configurações das lojas). O resultado é comparado com o estado
+persistido em alertas_estoque e só as TRANSIÇÕES são gravadas:
+
+    (ausente | resolvido) → novo → ativo → resolvido
+
+As notificações saem em lote por loja, apenas para alertas novos ainda não
+notificados. A rota /produtos/alertas só lê o estado persistido: quem
+sincroniza é o job agendado (app.tasks.estoque_alerts_task), e duas passadas
+simultâneas não colidem na unicidade (estabelecimento_id, chave).
+"""
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, select, update
+
+from app.models import db, AlertaEstoque, Configuracao, Estabelecimento, Produto, ProdutoLote
+
+logger = logging.getLogger(__name__)
+
+
+class EstoqueAlertasService:
+    """Detecção incremental e leitura dos alertas de estoque."""
+
+    DIAS_CRITICO = 7
+    DIAS_ALERTA_PADRAO = 30
+    DIAS_SEM_MOVIMENTO = 180
+
+    NIVEL_PRIORIDADE = {"critico": 1, "alto": 2, "medio": 3, "baixo": 4}
+
+    # ------------------------------------------------------------------
+    # Detecção (estado atual das condições)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _configuracoes(estabelecimento_id=None) -> Dict[int, Dict]:
+        q = db.session.query(
+            Configuracao.estabelecimento_id,
+            Configuracao.alerta_estoque_minimo,
+            Configuracao.controlar_validade,
+            Configuracao.dias_alerta_validade,
+        )
+        if estabelecimento_id is not None:
+            q = q.filter(Configuracao.estabelecimento_id == estabelecimento_id)
+        return {
+            row.estabelecimento_id: {
+                "estoque_minimo": row.alerta_estoque_minimo is not False,
+                "validade": row.controlar_validade is not False,
+                "dias_alerta": int(row.dias_alerta_validade or EstoqueAlertasService.DIAS_ALERTA_PADRAO),
+            }
+            for row in q.all()
+        }
+
+    @staticmethod
+    def detectar(estabelecimento_id=None, hoje: date = None) -> Dict[int, Dict[str, Dict]]:
+        """
+        Avalia todas as condições de alerta em uma passada.
+
+        Args:
+            estabelecimento_id: tenant; None avalia todos (job agendado).
+            hoje: data de referência (testes).
+
+        Returns:
+            {estabelecimento_id: {chave: {tipo, nivel, produto_id, lote_id, dados}}}
+        """
+        hoje = hoje or date.today()
+        configs = EstoqueAlertasService._configuracoes(estabelecimento_id)
+        padrao = {"estoque_minimo": True, "validade": True, "dias_alerta": EstoqueAlertasService.DIAS_ALERTA_PADRAO}
+        janela_max = max([c["dias_alerta"] for c in configs.values()] + [EstoqueAlertasService.DIAS_ALERTA_PADRAO])
+        limite_parado = datetime.utcnow() - timedelta(days=EstoqueAlertasService.DIAS_SEM_MOVIMENTO)
+
+        condicoes: Dict[int, Dict[str, Dict]] = {}
+
+        def _registrar(estab_id, tipo, nivel, produto_id, lote_id, dados):
+            chave = f"{tipo}:{produto_id}:{lote_id or 0}"
+            condicoes.setdefault(estab_id, {})[chave] = {
+                "tipo": tipo, "nivel": nivel, "produto_id": produto_id, "lote_id": lote_id, "dados": dados,
+            }
+
+        # 1) Produtos: ruptura/estoque baixo e produto parado, numa única consulta.
+        q = db.session.query(
+            Produto.id, Produto.estabelecimento_id, Produto.nome, Produto.quantidade,
+            Produto.quantidade_minima, Produto.ultima_venda,
+        ).filter(
+            Produto.ativo == True,  # noqa: E712
+            Produto.deleted_at.is_(None),
+            db.or_(Produto.controlar_estoque.is_(None), Produto.controlar_estoque == True),  # noqa: E712
+            db.or_(
+                db.and_(Produto.quantidade_minima > 0, Produto.quantidade <= Produto.quantidade_minima),
+                db.and_(Produto.quantidade > 0, Produto.ultima_venda < limite_parado),
+            ),
+        )
+        if estabelecimento_id is not None:
+            q = q.filter(Produto.estabelecimento_id == estabelecimento_id)
+
+        for p in q.all():
+            cfg = configs.get(p.estabelecimento_id, padrao)
+            qtd = float(p.quantidade or 0)
+            minima = float(p.quantidade_minima or 0)
+            if cfg["estoque_minimo"] and minima > 0 and qtd <= minima:
+                _registrar(p.estabelecimento_id, "estoque_baixo", "alto" if qtd <= 0 else "medio", p.id, None, {
+                    "produto_nome": p.nome, "quantidade": qtd, "quantidade_minima": minima,
+                })
+            if qtd > 0 and p.ultima_venda and p.ultima_venda < limite_parado:
+                _registrar(p.estabelecimento_id, "sem_movimento", "baixo", p.id, None, {
+                    "produto_nome": p.nome, "ultima_venda": p.ultima_venda.isoformat(),
+                })
+
+        # 2) Lotes: vencidos e vencendo, numa única consulta.
+        q = db.session.query(
+            ProdutoLote.id, ProdutoLote.estabelecimento_id, ProdutoLote.produto_id,
+            ProdutoLote.numero_lote, ProdutoLote.quantidade, ProdutoLote.data_validade, Produto.nome,
+        ).join(Produto, Produto.id == ProdutoLote.produto_id).filter(
+            ProdutoLote.ativo == True,  # noqa: E712
+            ProdutoLote.quantidade > 0,
+            ProdutoLote.data_validade <= hoje + timedelta(days=janela_max),
+            Produto.deleted_at.is_(None),
+        )
+        if estabelecimento_id is not None:
+            q = q.filter(ProdutoLote.estabelecimento_id == estabelecimento_id)
+
+        for lote in q.all():
+            cfg = configs.get(lote.estabelecimento_id, padrao)
+            if not cfg["validade"]:
+                continue
+            dias = (lote.data_validade - hoje).days
+            if dias < 0:
+                tipo, nivel = "lote_vencido", "critico"
+            elif dias <= EstoqueAlertasService.DIAS_CRITICO:
+                tipo, nivel = "lote_vencendo_critico", "critico"
+            elif dias <= cfg["dias_alerta"]:
+                tipo, nivel = "lote_vencendo_medio", "medio"
+            else:
+                continue
+            _registrar(lote.estabelecimento_id, tipo, nivel, lote.produto_id, lote.id, {
+                "produto_nome": lote.nome, "numero_lote": lote.numero_lote,
+                "quantidade_no_lote": float(lote.quantidade or 0),
+                "data_validade": lote.data_validade.isoformat(),
+            })
+
+        return condicoes
+
+    # ------------------------------------------------------------------
+    # Persistência incremental (só transições)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def sincronizar(estabelecimento_id=None, hoje: date = None) -> Dict[int, Dict[str, int]]:
+        """
+        Detecta as condições atuais e grava apenas as transições de estado.
+
+        Returns:
+            {estabelecimento_id: {"novos": n, "ativos": n, "resolvidos": n}}
+        """
+        agora = datetime.utcnow()
+        condicoes = EstoqueAlertasService.detectar(estabelecimento_id, hoje=hoje)
+        tabela = AlertaEstoque.__table__
+
+        existentes = select(tabela.c.id, tabela.c.estabelecimento_id, tabela.c.chave, tabela.c.estado)
+        if estabelecimento_id is not None:
+            existentes = existentes.where(tabela.c.estabelecimento_id == estabelecimento_id)
+        atuais = {(r.estabelecimento_id, r.chave): r for r in db.session.execute(existentes)}
+
+        inserir, reabrir, manter, resolver = [], [], [], []
+        resumo: Dict[int, Dict[str, int]] = {}
+
+        def _conta(estab_id, campo):
+            resumo.setdefault(estab_id, {"novos": 0, "ativos": 0, "resolvidos": 0})[campo] += 1
+
+        for estab_id, por_chave in condicoes.items():
+            for chave, c in por_chave.items():
+                row = atuais.get((estab_id, chave))
+                if row is None:
+                    inserir.append({
+                        "estabelecimento_id": estab_id, "chave": chave, "tipo": c["tipo"], "nivel": c["nivel"],
+                        "estado": "novo", "produto_id": c["produto_id"], "lote_id": c["lote_id"],
+                        "dados": c["dados"], "detectado_em": agora, "atualizado_em": agora,
+                    })
+                    _conta(estab_id, "novos")
+                elif row.estado == "resolvido":
+                    reabrir.append({"_id": row.id, "nivel": c["nivel"], "dados": c["dados"], "agora": agora})
+                    _conta(estab_id, "novos")
+                else:
+                    manter.append({"_id": row.id, "nivel": c["nivel"], "dados": c["dados"], "agora": agora})
+                    _conta(estab_id, "ativos")
+
+        for (estab_id, chave), row in atuais.items():
+            if row.estado != "resolvido" and chave not in condicoes.get(estab_id, {}):
+                resolver.append({"_id": row.id, "agora": agora})
+                _conta(estab_id, "resolvidos")
+
+        # Core + executemany: snapshot derivado, não passa pela auditoria forense por linha.
+        if inserir:
+            db.session.execute(EstoqueAlertasService._inserir_novos(tabela), inserir)
+        if reabrir:
+            db.session.execute(
+                update(tabela).where(tabela.c.id == bindparam("_id")).values(
+                    estado="novo", nivel=bindparam("nivel"), dados=bindparam("dados"),
+                    detectado_em=bindparam("agora"), atualizado_em=bindparam("agora"),
+                    resolvido_em=None, notificado_em=None,
+                ),
+                reabrir,
+            )
+        if manter:
+            db.session.execute(
+                update(tabela).where(tabela.c.id == bindparam("_id")).values(
+                    estado="ativo", nivel=bindparam("nivel"), dados=bindparam("dados"),
+                    atualizado_em=bindparam("agora"),
+                ),
+                manter,
+            )
+        if resolver:
+            db.session.execute(
+                update(tabela).where(tabela.c.id == bindparam("_id")).values(
+                    estado="resolvido", resolvido_em=bindparam("agora"), atualizado_em=bindparam("agora"),
+                ),
+                resolver,
+            )
+        db.session.commit()
+        return resumo
+
+    @staticmethod
+    def _inserir_novos(tabela):
+        """INSERT que ignora a chave já gravada por outra passada concorrente
+        (a outra passada viu a mesma condição; a próxima rodada a marca ativa)."""
+        dialeto = db.session.get_bind().dialect.name
+        if dialeto in ("postgresql", "sqlite"):
+            if dialeto == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as _insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as _insert
+            return _insert(tabela).on_conflict_do_nothing(index_elements=["estabelecimento_id", "chave"])
+        return tabela.insert()
+
+    @staticmethod
+    def dias_alerta(estabelecimento_id) -> int:
+        """Janela de validade da loja (Configuracao.dias_alerta_validade)."""
+        config = EstoqueAlertasService._configuracoes(estabelecimento_id).get(estabelecimento_id)
+        return config["dias_alerta"] if config else EstoqueAlertasService.DIAS_ALERTA_PADRAO
+
+    # ------------------------------------------------------------------
+    # Notificação em lote por loja
+    # ------------------------------------------------------------------
+    @staticmethod
+    def notificar_pendentes(estabelecimento_id=None) -> Dict[int, int]:
+        """Envia UM resumo por loja com os alertas novos ainda não notificados.
+
+        O claim (UPDATE ... WHERE notificado_em IS NULL RETURNING id) garante que
+        dois workers rodando o job ao mesmo tempo não enviem o mesmo alerta duas
+        vezes: cada um envia só os ids que reivindicou. Se o envio falha, o claim
+        é desfeito e os alertas voltam para a próxima rodada.
+        """
+        from app.services.email_service import notificar_alertas_estoque
+
+        q = AlertaEstoque.query.filter(
+            AlertaEstoque.estado == "novo", AlertaEstoque.notificado_em.is_(None)
+        )
+        if estabelecimento_id is not None:
+            q = q.filter(AlertaEstoque.estabelecimento_id == estabelecimento_id)
+
+        por_loja: Dict[int, List[AlertaEstoque]] = {}
+        for alerta in q.all():
+            por_loja.setdefault(alerta.estabelecimento_id, []).append(alerta)
+        if not por_loja:
+            return {}
+
+        configs = {
+            c.estabelecimento_id: bool(c.alertas_email)
+            for c in Configuracao.query.filter(Configuracao.estabelecimento_id.in_(list(por_loja))).all()
+        }
+        lojas = {e.id: e for e in Estabelecimento.query.filter(Estabelecimento.id.in_(list(por_loja))).all()}
+
+        tabela = AlertaEstoque.__table__
+        enviados = {}
+        for estab_id, alertas in por_loja.items():
+            marca = datetime.utcnow()
+            reivindicados = set(db.session.execute(
+                update(tabela)
+                .where(tabela.c.id.in_([a.id for a in alertas]), tabela.c.notificado_em.is_(None))
+                .values(notificado_em=marca)
+                .returning(tabela.c.id)
+            ).scalars())
+            db.session.commit()
+            if not reivindicados:
+                continue  # outro worker já notificou este lote
+            estab = lojas.get(estab_id)
+            if estab and configs.get(estab_id) and estab.email:
+                payload = [EstoqueAlertasService.formatar(a) for a in alertas if a.id in reivindicados]
+                payload.sort(key=lambda x: EstoqueAlertasService.NIVEL_PRIORIDADE.get(x["nivel"], 5))
+                try:
+                    ok = notificar_alertas_estoque(estab, payload)
+                except Exception as e:
+                    logger.error(f"Falha ao notificar alertas de estoque da loja {estab_id}: {e}")
+                    ok = False
+                if not ok:
+                    db.session.execute(
+                        update(tabela)
+                        .where(tabela.c.id.in_(reivindicados), tabela.c.notificado_em == marca)
+                        .values(notificado_em=None)
+                    )
+                    db.session.commit()
+                    continue
+            enviados[estab_id] = len(reivindicados)
+        return enviados
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+    @staticmethod
+    def formatar(alerta: AlertaEstoque, hoje: date = None) -> Dict:
+        """Monta o payload do alerta (dias e mensagem calculados na leitura)."""
+        hoje = hoje or date.today()
+        d = dict(alerta.dados or {})
+        base = {
+            "id": alerta.id,
+            "tipo": alerta.tipo,
+            "nivel": alerta.nivel,
+            "estado": alerta.estado,
+            "produto_id": alerta.produto_id,
+            "produto_nome": d.get("produto_nome"),
+            "detectado_em": alerta.detectado_em.isoformat() if alerta.detectado_em else None,
+        }
+        if alerta.tipo.startswith("lote_"):
+            validade = date.fromisoformat(d["data_validade"])
+            dias = (validade - hoje).days
+            lote = d.get("numero_lote")
+            qtd = d.get("quantidade_no_lote")
+            base.update({
+                "lote_id": alerta.lote_id, "numero_lote": lote,
+                "quantidade_no_lote": qtd, "data_validade": d["data_validade"],
+            })
+            if alerta.tipo == "lote_vencido":
+                base.update({
+                    "dias_vencido": -dias,
+                    "mensagem": f"VENCIDO há {-dias} dia(s)! Lote {lote} com {qtd} un. Retirar imediatamente.",
+                    "acao_sugerida": "Retirar da gôndola e registrar perda/descarte",
+                })
+            elif alerta.tipo == "lote_vencendo_critico":
+                base.update({
+                    "dias_restantes": dias,
+                    "mensagem": f"Vence em {dias} dia(s)! Lote {lote} com {qtd} un.",
+                    "acao_sugerida": "Colocar em promoção ou posicionar na frente da gôndola (FIFO)",
+                })
+            else:
+                base.update({
+                    "dias_restantes": dias,
+                    "mensagem": f"Vence em {dias} dia(s). Lote {lote} com {qtd} un.",
+                    "acao_sugerida": "Monitorar e priorizar venda via FIFO",
+                })
+        elif alerta.tipo == "estoque_baixo":
+            base.update({
+                "quantidade": d.get("quantidade"),
+                "quantidade_minima": d.get("quantidade_minima"),
+                "mensagem": f"Estoque baixo: {d.get('quantidade')} un. (mín: {d.get('quantidade_minima')})",
+                "acao_sugerida": "Criar pedido de compra para reposição",
+            })
+        elif alerta.tipo == "sem_movimento":
+            ultima = datetime.fromisoformat(d["ultima_venda"])
+            dias_sem_venda = (datetime.utcnow() - ultima).days
+            base.update({
+                "dias_sem_venda": dias_sem_venda,
+                "ultima_venda": d["ultima_venda"],
+                "mensagem": f"Sem vendas há {dias_sem_venda} dias",
+                "acao_sugerida": "Avaliar promoção ou remoção do mix de produtos",
+            })
+        return base
+
+    @staticmethod
+    def listar(estabelecimento_id, tipo: Optional[str] = None, dias_alerta: Optional[int] = None) -> List[Dict]:
+        """Alertas abertos do tenant (mais críticos primeiro). Só leitura: não sincroniza."""
+        q = AlertaEstoque.query.filter(
+            AlertaEstoque.estabelecimento_id == estabelecimento_id,
+            AlertaEstoque.estado.in_(AlertaEstoque.ESTADOS_ABERTOS),
+        )
+        if tipo:
+            q = q.filter(AlertaEstoque.tipo == tipo)
+
+        hoje = date.today()
+        alertas = [EstoqueAlertasService.formatar(a, hoje) for a in q.all()]
+        if dias_alerta is not None:
+            alertas = [
+                a for a in alertas
+                if a["tipo"] != "lote_vencendo_medio" or a["dias_restantes"] <= dias_alerta
+            ]
+        alertas.sort(key=lambda a: (
+            EstoqueAlertasService.NIVEL_PRIORIDADE.get(a["nivel"], 5), a.get("data_validade") or "",
+        ))
+        return alertas
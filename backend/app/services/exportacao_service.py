@@ -0,0 +1,369 @@
+"""
+Exportações tabulares em stream (produtos, clientes, vendas, fornecedores).
+
+Cada módulo de rotas registra uma definição (`@registrar_exportacao`) que
+recebe o tenant e os MESMOS parâmetros de filtro da listagem correspondente
+e devolve uma `Exportacao`: um select só de colunas (nada de objetos ORM) e
+as colunas do arquivo. A partir dela:
+
+- CSV sai em stream (`resposta_csv`): as linhas vêm do banco com yield_per e
+  são escritas em blocos na resposta — memória constante, sem `.all()` nem o
+  arquivo inteiro num StringIO;
+- XLSX é escrito linha a linha num workbook write-only do openpyxl, num
+  arquivo temporário que é apagado ao fim do envio (`resposta_xlsx`);
+- exportações muito grandes (`assincrono=true`) viram um job em
+  exportacoes_arquivos: workers (ExportacaoWorker) geram o arquivo em
+  EXPORTACAO_FOLDER e o usuário baixa por
+  /api/relatorios/exportacoes/<handle>/arquivo até expirar.
+
+Sem workers no processo (TESTING/EXPORTACAO_WORKERS=0) o job roda em linha,
+logo após ser agendado. Com mais de uma máquina, EXPORTACAO_FOLDER deve ser
+um volume compartilhado.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+from flask import Response, current_app, jsonify, send_file, stream_with_context
+from sqlalchemy import or_, select
+from werkzeug.datastructures import MultiDict
+
+from app.models import db, ExportacaoArquivo, utcnow
+
+logger = logging.getLogger(__name__)
+
+FORMATOS = ("csv", "xlsx")
+MIMETYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+_WORKERS = int(os.getenv("EXPORTACAO_WORKERS", "1"))
+_MAX_TENTATIVAS = int(os.getenv("EXPORTACAO_MAX_TENTATIVAS", "3"))
+_BACKOFF_BASE = 60.0
+_LEASE_SEC = 1800  # um job grande pode levar minutos
+_VALIDADE_HORAS = int(os.getenv("EXPORTACAO_VALIDADE_HORAS", "24"))
+_LOTE = 1000  # linhas por ida ao banco e por bloco escrito na resposta
+_POLL_SEC = 10.0
+
+_definicoes: Dict[str, Callable[..., "Exportacao"]] = {}
+_acordar = threading.Event()
+_workers: List["ExportacaoWorker"] = []
+
+
+class Coluna(NamedTuple):
+    """Coluna do arquivo: `valor` é o nome de um campo do select (None vira "")
+    ou uma função que recebe a linha inteira."""
+    titulo: str
+    valor: Union[str, Callable[[Any], Any]]
+
+
+def _extrator(valor) -> Callable[[Any], Any]:
+    if callable(valor):
+        return valor
+
+    def _campo(linha):
+        v = getattr(linha, valor)
+        return "" if v is None else v
+    return _campo
+
+
+class Exportacao:
+    """Select só de colunas + layout do arquivo."""
+
+    def __init__(self, nome: str, consulta, colunas: Sequence[Coluna], aba: Optional[str] = None,
+                 delimitador: str = ";", bom: bool = False):
+        self.nome = nome
+        self.consulta = consulta
+        self.colunas = list(colunas)
+        self.aba = (aba or nome.title())[:31]
+        self.delimitador = delimitador
+        self.bom = bom
+        self.total = 0
+        self._valores = [_extrator(c.valor) for c in self.colunas]
+
+    @property
+    def titulos(self) -> List[str]:
+        return [c.titulo for c in self.colunas]
+
+    def linhas(self, lote: Optional[int] = None) -> Iterator[list]:
+        """Linhas formatadas, lidas do banco em blocos (server-side cursor no PostgreSQL)."""
+        self.total = 0
+        resultado = db.session.execute(self.consulta.execution_options(yield_per=lote or _LOTE))
+        try:
+            for linha in resultado:
+                self.total += 1
+                yield [valor(linha) for valor in self._valores]
+        finally:
+            resultado.close()
+
+
+def registrar_exportacao(tipo: str):
+    """Decorator: `fn(estabelecimento_id, args) -> Exportacao` passa a atender `tipo`
+    (na requisição e nos jobs em background)."""
+    def _registrar(fn):
+        _definicoes[tipo] = fn
+        return fn
+    return _registrar
+
+
+def construir(tipo: str, estabelecimento_id, args) -> Exportacao:
+    if tipo not in _definicoes:
+        raise ValueError(f"Exportação desconhecida: {tipo}")
+    if not isinstance(args, MultiDict):
+        args = MultiDict(args or {})
+    return _definicoes[tipo](estabelecimento_id, args)
+
+
+# ---------------------------------------------------------------- escrita
+
+def gerar_csv(exportacao: Exportacao, lote: Optional[int] = None) -> Iterator[str]:
+    """Blocos de texto CSV; nunca acumula mais que `lote` linhas."""
+    lote = lote or _LOTE
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=exportacao.delimitador)
+    if exportacao.bom:
+        buffer.write("\ufeff")
+    escritor.writerow(exportacao.titulos)
+    for n, linha in enumerate(exportacao.linhas(lote), 1):
+        escritor.writerow(linha)
+        if n % lote == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gravar_csv(exportacao: Exportacao, caminho: str) -> int:
+    with open(caminho, "w", encoding="utf-8", newline="") as f:
+        for bloco in gerar_csv(exportacao):
+            f.write(bloco)
+    return exportacao.total
+
+
+def gravar_xlsx(exportacao: Exportacao, caminho: str) -> int:
+    """Workbook write-only: cada linha vai para o XML temporário da planilha
+    assim que é anexada, sem manter as células em memória."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    planilha = wb.create_sheet(exportacao.aba)
+    planilha.append(exportacao.titulos)
+    for linha in exportacao.linhas():
+        planilha.append(linha)
+    wb.save(caminho)
+    return exportacao.total
+
+
+def resposta_csv(exportacao: Exportacao, nome_arquivo: str, mimetype: str = "text/csv") -> Response:
+    resp = Response(stream_with_context(gerar_csv(exportacao)), mimetype=f"{mimetype}; charset=utf-8")
+    resp.headers["Content-Disposition"] = f'attachment; filename="{nome_arquivo}"'
+    return resp
+
+
+def resposta_xlsx(exportacao: Exportacao, nome_arquivo: str) -> Response:
+    fd, caminho = tempfile.mkstemp(prefix="exportacao_", suffix=".xlsx")
+    os.close(fd)
+    try:
+        gravar_xlsx(exportacao, caminho)
+    except Exception:
+        _apagar(caminho)
+        raise
+    resp = send_file(caminho, mimetype=MIMETYPE_XLSX, as_attachment=True, download_name=nome_arquivo, max_age=0)
+    resp.call_on_close(lambda: _apagar(caminho))
+    return resp
+
+
+def responder(tipo: str, estabelecimento_id, args, formato: str, nome_arquivo: str,
+              funcionario_id: Optional[int] = None, mimetype_csv: str = "text/csv"):
+    """Atende uma rota de exportação: job em background (`assincrono=true`),
+    CSV em stream ou XLSX via arquivo temporário. ValueError para formato inválido."""
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato não suportado: {formato}. Use csv ou excel.")
+    if str(args.get("assincrono", "")).lower() in ("1", "true", "sim"):
+        job = ExportacaoService.agendar(tipo, formato, estabelecimento_id, args, funcionario_id, nome_arquivo)
+        return jsonify({"success": True, "exportacao": job.to_dict()}), 202
+    exportacao = construir(tipo, estabelecimento_id, args)
+    if formato == "xlsx":
+        return resposta_xlsx(exportacao, nome_arquivo)
+    return resposta_csv(exportacao, nome_arquivo, mimetype_csv)
+
+
+def _apagar(*caminhos: str) -> None:
+    for caminho in caminhos:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+def _pasta_exportacoes() -> str:
+    pasta = current_app.config.get("EXPORTACAO_FOLDER") or os.path.join(current_app.instance_path, "exports")
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+def backoff(tentativas: int) -> float:
+    return _BACKOFF_BASE * (2 ** max(0, tentativas - 1))
+
+
+# ---------------------------------------------------------------- jobs
+
+class ExportacaoService:
+
+    @staticmethod
+    def ativa() -> bool:
+        """Há workers neste processo? Sem eles o job roda em linha."""
+        return any(w.is_alive() for w in _workers)
+
+    @staticmethod
+    def agendar(tipo: str, formato: str, estabelecimento_id, args, funcionario_id: Optional[int] = None,
+                nome_arquivo: Optional[str] = None) -> ExportacaoArquivo:
+        """Grava o job (com os filtros da requisição), commita e despacha."""
+        if tipo not in _definicoes:
+            raise ValueError(f"Exportação desconhecida: {tipo}")
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato não suportado: {formato}")
+        filtros = args.to_dict(flat=False) if isinstance(args, MultiDict) else dict(args or {})
+        filtros.pop("assincrono", None)
+        handle = uuid.uuid4().hex
+        job = ExportacaoArquivo(
+            handle=handle,
+            estabelecimento_id=None if str(estabelecimento_id).lower() == "all" else estabelecimento_id,
+            funcionario_id=int(funcionario_id) if str(funcionario_id or "").isdigit() else None, tipo=tipo, formato=formato,
+            filtros_json=json.dumps(filtros, ensure_ascii=False),
+            nome_arquivo=nome_arquivo or f"{tipo}.{formato}", status="pendente",
+            proxima_tentativa_em=utcnow(),
+        )
+        db.session.add(job)
+        db.session.commit()
+        if ExportacaoService.ativa():
+            _acordar.set()
+        else:
+            ExportacaoService.processar_pendentes(ids=[job.id])
+            db.session.refresh(job)
+        return job
+
+    @staticmethod
+    def _reivindicar(limite: int, ids: Optional[Iterable[int]] = None) -> List[int]:
+        t = ExportacaoArquivo.__table__
+        agora = utcnow()
+        vencidos = (t.c.status == "pendente",
+                    or_(t.c.proxima_tentativa_em.is_(None), t.c.proxima_tentativa_em <= agora))
+        if ids is None:
+            ids = db.session.execute(
+                select(t.c.id).where(*vencidos).order_by(t.c.proxima_tentativa_em, t.c.id).limit(limite)
+            ).scalars().all()
+        ids = list(ids)
+        if not ids:
+            return []
+        reivindicados = db.session.execute(
+            t.update().where(t.c.id.in_(ids), *vencidos)
+            .values(proxima_tentativa_em=agora + timedelta(seconds=_LEASE_SEC), tentativas=t.c.tentativas + 1)
+            .returning(t.c.id)
+        ).scalars().all()
+        db.session.commit()
+        return sorted(reivindicados)
+
+    @staticmethod
+    def processar_pendentes(limite: int = 2, ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+        """Gera os arquivos de um lote de jobs. Retorna contagem por status."""
+        contagem: Dict[str, int] = {}
+        for job_id in ExportacaoService._reivindicar(limite, ids):
+            status = ExportacaoService._processar_um(job_id)
+            contagem[status] = contagem.get(status, 0) + 1
+        return contagem
+
+    @staticmethod
+    def _processar_um(job_id: int) -> str:
+        t = ExportacaoArquivo.__table__
+        job = db.session.execute(select(t).where(t.c.id == job_id)).mappings().one()
+        caminho = os.path.join(_pasta_exportacoes(), f"{job['handle']}.{job['formato']}")
+        parcial = f"{caminho}.part"
+        try:
+            exportacao = construir(job["tipo"], job["estabelecimento_id"] or "all",
+                                   MultiDict(json.loads(job["filtros_json"] or "{}")))
+            gravar = gravar_xlsx if job["formato"] == "xlsx" else gravar_csv
+            linhas = gravar(exportacao, parcial)
+            os.replace(parcial, caminho)
+        except Exception as e:
+            db.session.rollback()
+            _apagar(parcial)
+            definitivo = job["tentativas"] >= _MAX_TENTATIVAS
+            db.session.execute(t.update().where(t.c.id == job_id).values(
+                status="falhou" if definitivo else "pendente", ultimo_erro=str(e)[:1000],
+                proxima_tentativa_em=None if definitivo else utcnow() + timedelta(seconds=backoff(job["tentativas"])),
+            ))
+            db.session.commit()
+            logger.error(f"[EXPORTAÇÃO] {job['handle']} (tentativa {job['tentativas']}): {e}")
+            return "falhou" if definitivo else "pendente"
+
+        agora = utcnow()
+        db.session.execute(t.update().where(t.c.id == job_id).values(
+            status="pronto", caminho=caminho, linhas=linhas, tamanho=os.path.getsize(caminho),
+            ultimo_erro=None, proxima_tentativa_em=None, concluido_em=agora,
+            expira_em=agora + timedelta(hours=_VALIDADE_HORAS),
+        ))
+        db.session.commit()
+        return "pronto"
+
+    @staticmethod
+    def localizar(handle: str, estabelecimento_id) -> Optional[ExportacaoArquivo]:
+        """Job do tenant (super admin em 'all' enxerga todos)."""
+        consulta = select(ExportacaoArquivo).where(ExportacaoArquivo.handle == handle)
+        if str(estabelecimento_id).lower() != "all":
+            consulta = consulta.where(ExportacaoArquivo.estabelecimento_id == estabelecimento_id)
+        return db.session.execute(consulta).scalar()
+
+    @staticmethod
+    def limpar_expirados() -> int:
+        """Apaga os arquivos vencidos e os registros deles."""
+        t = ExportacaoArquivo.__table__
+        vencidos = db.session.execute(
+            select(t.c.id, t.c.caminho).where(t.c.expira_em.isnot(None), t.c.expira_em < utcnow())
+        ).all()
+        if not vencidos:
+            return 0
+        _apagar(*[c for _, c in vencidos if c])
+        db.session.execute(t.delete().where(t.c.id.in_([i for i, _ in vencidos])))
+        db.session.commit()
+        return len(vencidos)
+
+
+class ExportacaoWorker(threading.Thread):
+    def __init__(self, app, indice: int):
+        super().__init__(name=f"exportacao-{indice}")
+        self.app = app
+        self.daemon = True
+
+    def run(self):
+        while True:
+            _acordar.wait(timeout=_POLL_SEC)
+            _acordar.clear()
+            try:
+                with self.app.app_context():
+                    while ExportacaoService.processar_pendentes():
+                        pass
+                    ExportacaoService.limpar_expirados()
+            except Exception as e:
+                self.app.logger.error(f"[EXPORTAÇÃO] Erro no ciclo de exportações: {e}")
+
+
+def start_exportacoes(app):
+    """Inicia os workers de exportação. Retorna a lista de threads (vazia se desabilitado)."""
+    if app.config.get("TESTING") or _WORKERS <= 0:
+        app.logger.info("[EXPORTAÇÃO] Workers NÃO iniciados (desabilitado); jobs processados em linha.")
+        return []
+    if not _workers:
+        for i in range(_WORKERS):
+            worker = ExportacaoWorker(app, i)
+            worker.start()
+            _workers.append(worker)
+        app.logger.info(f"[EXPORTAÇÃO] {_WORKERS} worker(s) de exportação iniciado(s).")
+    return list(_workers)
@@ -0,0 +1,646 @@
+"""
+Razão financeiro mensal por loja (tabela financeiro_mensal).
+
+Uma linha por (competência, rubrica, categoria) com valor e quantidade:
+despesas por categoria (e a parte recorrente), contas a pagar em aberto (por
+vencimento) e pagas (por data de pagamento), contas a receber em aberto e
+recebidas, receita, valor recebido e CMV das vendas e custo da folha dos meses
+já fechados. As telas financeiras (estatísticas de despesas, resumo
+financeiro, histórico comparativo) disparavam juntas cada uma os seus
+agregados sobre despesas, contas e vendas — inclusive um GROUP BY por
+EXTRACT(year/month) de 12 meses; agora leem o período inteiro numa consulta
+pelo índice único (estabelecimento_id, competencia, ...) e a comparação mês a
+mês é uma consulta de dicionário.
+
+Manutenção:
+- deltas: o before_flush (app.models) guarda a contribuição atual das linhas
+  de origem tocadas e o after_flush soma (depois − antes) por UPSERT, na mesma
+  transação — mesma regra de _acumular_total_caixa;
+- reconciliação: ``reconciliar`` recalcula os meses a partir das tabelas de
+  origem (faixas sargáveis, índices por tenant + data) e corrige divergências
+  de escritas fora do ORM; roda todas as noites (tasks/financeiro_task.py:
+  meses recentes e os futuros com lançamento) e ao fim das cargas em lote
+  que gravam direto nas tabelas (restauro de backup). Loja ainda não
+  reconciliada é lida na hora das tabelas de origem, sem gravar: leitura
+  nunca escreve no razão;
+- folha: só meses fechados, gravada pela reconciliação com
+  calcular_custo_folha_periodos; o que falta (e o mês corrente, que muda a
+  cada dia) é calculado na hora.
+"""
+import calendar
+import logging
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, case, func, or_, select
+
+from app.models import (
+    db, ContaPagar, ContaReceber, Despesa, Estabelecimento, FinanceiroMensal, Produto, Venda, VendaItem,
+    janela_particionada, utcnow,
+)
+from app.utils.financeiro_constants import CATEGORIAS_ESPELHO_BOLETO, CATEGORIAS_INTEGRADAS
+from app.utils.query_helpers import filtro_periodo
+from app.utils.timezone import hoje_local, intervalo_utc, to_local
+
+logger = logging.getLogger(__name__)
+
+DESPESA = "despesa"
+DESPESA_RECORRENTE = "despesa_recorrente"
+PAGAR_ABERTO = "pagar_aberto"
+PAGAR_PAGO = "pagar_pago"
+RECEBER_ABERTO = "receber_aberto"
+RECEBER_RECEBIDO = "receber_recebido"
+RECEITA = "receita"
+VENDAS_RECEBIDO = "vendas_recebido"
+CMV = "cmv"
+FOLHA = "folha"
+RECONCILIADO = "reconciliado"  # marca (valor 0) do último acerto do mês com as tabelas de origem
+
+STATUS_PAGAR_ABERTO = ("aberto", "parcial")
+STATUS_PAGAR_PAGO = ("pago", "parcial")
+STATUS_RECEBER_ABERTO = ("aberto", "parcial")
+
+_LOTE_IDS = 500
+_ZERO = Decimal("0")
+_TOLERANCIA = Decimal("0.0001")
+
+_lock = threading.Lock()
+_verificados: set = set()
+
+
+def competencia_de(valor) -> Optional[date]:
+    """1º dia do mês de uma data; datetimes (UTC naive) no mês LOCAL da loja."""
+    if valor is None:
+        return None
+    if isinstance(valor, datetime):
+        valor = to_local(valor).date()
+    return valor.replace(day=1)
+
+
+def fim_do_mes(competencia: date) -> date:
+    return competencia.replace(day=calendar.monthrange(competencia.year, competencia.month)[1])
+
+
+def meses_entre(inicio: date, fim: date) -> List[date]:
+    """Competências de inicio..fim (inclusive)."""
+    atual, ultimo, meses = inicio.replace(day=1), fim.replace(day=1), []
+    while atual <= ultimo:
+        meses.append(atual)
+        atual = (atual + timedelta(days=32)).replace(day=1)
+    return meses
+
+
+def meses_inteiros(inicio: date, fim: date, hoje: date = None) -> Optional[List[date]]:
+    """
+    Competências cobertas exatamente pelo período, ou None se ele corta um mês
+    ao meio (aí o chamador agrega direto nas tabelas de origem).
+
+    O mês corrente conta como inteiro quando o período vai até hoje (ou além):
+    lançamentos já agendados para o resto do mês entram nele.
+    """
+    hoje = hoje or hoje_local()
+    if not inicio or not fim or fim < inicio or inicio.day != 1:
+        return None
+    if fim != fim_do_mes(fim) and not (fim.replace(day=1) == hoje.replace(day=1) and fim >= hoje):
+        return None
+    return meses_entre(inicio, fim)
+
+
+def _dec(valor) -> Decimal:
+    return Decimal(str(valor or 0))
+
+
+def _categoria(valor) -> str:
+    return (valor or "")[:50]
+
+
+def _fora(categoria: str, excluir) -> bool:
+    return bool(excluir) and categoria.strip().lower() in excluir
+
+
+class RazaoMensal:
+    """Linhas do razão de um estabelecimento já em memória: {(competência, rubrica, categoria): (valor, qtd)}."""
+
+    def __init__(self, linhas: Dict[tuple, tuple]):
+        self.linhas = linhas
+
+    def _filtradas(self, rubrica, meses=None, excluir=None):
+        meses = set(meses) if meses is not None else None
+        for (comp, rub, cat), (valor, qtd) in self.linhas.items():
+            if rub == rubrica and (meses is None or comp in meses) and not _fora(cat, excluir):
+                yield comp, cat, valor, qtd
+
+    def valor(self, rubrica, meses=None, excluir=None) -> Decimal:
+        return sum((v for _, _, v, _ in self._filtradas(rubrica, meses, excluir)), _ZERO)
+
+    def quantidade(self, rubrica, meses=None, excluir=None) -> int:
+        return sum(q for _, _, _, q in self._filtradas(rubrica, meses, excluir))
+
+    def por_mes(self, rubrica, excluir=None) -> Dict[date, Decimal]:
+        totais = defaultdict(lambda: _ZERO)
+        for comp, _, valor, _ in self._filtradas(rubrica, excluir=excluir):
+            totais[comp] += valor
+        return dict(totais)
+
+    def por_categoria(self, rubrica, meses=None, excluir=None) -> Dict[str, tuple]:
+        totais = defaultdict(lambda: [_ZERO, 0])
+        for _, cat, valor, qtd in self._filtradas(rubrica, meses, excluir):
+            totais[cat][0] += valor
+            totais[cat][1] += qtd
+        return {cat: (v, q) for cat, (v, q) in totais.items()}
+
+    def tem(self, rubrica, competencia) -> bool:
+        return any(True for _ in self._filtradas(rubrica, [competencia]))
+
+    def vendas(self, meses=None) -> Dict:
+        """Mesmo formato de DataLayer.get_sales_financials (+ total_recebido)."""
+        receita, cmv = float(self.valor(RECEITA, meses)), float(self.valor(CMV, meses))
+        return {"revenue": receita, "cogs": cmv, "gross_profit": receita - cmv,
+                "count": self.quantidade(RECEITA, meses),
+                "total_recebido": float(self.valor(VENDAS_RECEBIDO, meses))}
+
+    def despesas(self, meses=None) -> Dict:
+        """Operacionais e recorrentes sem as categorias espelhadas; caixa sem os espelhos de boleto."""
+        return {"despesas_operacionais": float(self.valor(DESPESA, meses, CATEGORIAS_INTEGRADAS)),
+                "recorrentes": float(self.valor(DESPESA_RECORRENTE, meses, CATEGORIAS_INTEGRADAS)),
+                "despesas_caixa": float(self.valor(DESPESA, meses, CATEGORIAS_ESPELHO_BOLETO))}
+
+
+def _acumular(conn, estabelecimento_id, competencia, rubrica, categoria, valor: Decimal, quantidade: int):
+    """UPSERT atômico (valor/quantidade += delta) numa linha do razão."""
+    tabela = FinanceiroMensal.__table__
+    agora = utcnow()
+    chave = {"estabelecimento_id": estabelecimento_id, "competencia": competencia,
+             "rubrica": rubrica, "categoria": categoria}
+
+    dialeto = conn.dialect.name
+    if dialeto in ("postgresql", "sqlite"):
+        if dialeto == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as _insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as _insert
+        stmt = _insert(tabela).values(valor=valor, quantidade=quantidade, atualizado_em=agora, **chave)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=["estabelecimento_id", "competencia", "rubrica", "categoria"],
+            set_={"valor": tabela.c.valor + valor, "quantidade": tabela.c.quantidade + quantidade,
+                  "atualizado_em": agora},
+        ))
+        return
+
+    res = conn.execute(
+        tabela.update()
+        .where(*(tabela.c[k] == v for k, v in chave.items()))
+        .values(valor=tabela.c.valor + valor, quantidade=tabela.c.quantidade + quantidade, atualizado_em=agora)
+    )
+    if not res.rowcount:
+        conn.execute(tabela.insert().values(valor=valor, quantidade=quantidade, atualizado_em=agora, **chave))
+
+
+# ── Contribuição de linhas de origem (por id): base dos deltas ─────────────
+
+def _despesas_por_id(conn, ids):
+    d = Despesa.__table__
+    for r in conn.execute(select(d.c.estabelecimento_id, d.c.data_despesa, d.c.categoria, d.c.valor,
+                                 d.c.recorrente).where(d.c.id.in_(ids))):
+        comp, cat = competencia_de(r.data_despesa), _categoria(r.categoria)
+        yield (r.estabelecimento_id, comp, DESPESA, cat), _dec(r.valor), 1
+        if r.recorrente:
+            yield (r.estabelecimento_id, comp, DESPESA_RECORRENTE, cat), _dec(r.valor), 1
+
+
+def _contas_pagar_por_id(conn, ids):
+    c = ContaPagar.__table__
+    for r in conn.execute(select(c.c.estabelecimento_id, c.c.data_vencimento, c.c.data_pagamento, c.c.status,
+                                 c.c.valor_atual, c.c.valor_pago).where(c.c.id.in_(ids))):
+        if r.status in STATUS_PAGAR_ABERTO and r.data_vencimento:
+            yield ((r.estabelecimento_id, competencia_de(r.data_vencimento), PAGAR_ABERTO, ""),
+                   _dec(r.valor_atual) - _dec(r.valor_pago), 1)
+        if r.status in STATUS_PAGAR_PAGO and r.data_pagamento:
+            yield (r.estabelecimento_id, competencia_de(r.data_pagamento), PAGAR_PAGO, ""), _dec(r.valor_pago), 1
+
+
+def _contas_receber_por_id(conn, ids):
+    c = ContaReceber.__table__
+    for r in conn.execute(select(c.c.estabelecimento_id, c.c.data_vencimento, c.c.data_recebimento, c.c.status,
+                                 c.c.valor_atual, c.c.valor_recebido).where(c.c.id.in_(ids))):
+        if r.status in STATUS_RECEBER_ABERTO and r.data_vencimento:
+            yield (r.estabelecimento_id, competencia_de(r.data_vencimento), RECEBER_ABERTO, ""), _dec(r.valor_atual), 1
+        if r.data_recebimento and r.status != "cancelado":
+            yield ((r.estabelecimento_id, competencia_de(r.data_recebimento), RECEBER_RECEBIDO, ""),
+                   _dec(r.valor_recebido), 1)
+
+
+def _custo_itens():
+    i, p = VendaItem.__table__, Produto.__table__
+    return func.sum(func.coalesce(i.c.custo_unitario, p.c.preco_custo, 0) * i.c.quantidade), i, p
+
+
+def _vendas_por_id(conn, ids):
+    v = Venda.__table__
+    custo, i, p = _custo_itens()
+    custos = dict(conn.execute(
+        select(i.c.venda_id, custo).select_from(i.outerjoin(p, p.c.id == i.c.produto_id))
+        .where(i.c.venda_id.in_(ids)).group_by(i.c.venda_id)
+    ).all())
+    for r in conn.execute(select(v.c.id, v.c.estabelecimento_id, v.c.data_venda, v.c.status, v.c.total,
+                                 v.c.valor_recebido).where(v.c.id.in_(ids), v.c.deleted_at.is_(None))):
+        if r.status is None or r.status == "cancelada":
+            continue
+        comp = competencia_de(r.data_venda)
+        yield (r.estabelecimento_id, comp, RECEITA, ""), _dec(r.total), 1
+        yield (r.estabelecimento_id, comp, VENDAS_RECEBIDO, ""), _dec(r.valor_recebido), 1
+        yield (r.estabelecimento_id, comp, CMV, ""), _dec(custos.get(r.id)), 1
+
+
+_POR_ID = {"despesas": _despesas_por_id, "contas_pagar": _contas_pagar_por_id,
+           "contas_receber": _contas_receber_por_id, "vendas": _vendas_por_id}
+
+
+# ── Livro do mês (agregado nas tabelas de origem): base da reconciliação ──
+
+def _livro_do_mes(conn, estabelecimento_id, competencia) -> Dict[tuple, list]:
+    """{(rubrica, categoria): [valor, qtd]} recalculado das tabelas de origem (mesmas regras dos deltas)."""
+    inicio, fim = competencia, fim_do_mes(competencia)
+    livro = defaultdict(lambda: [_ZERO, 0])
+
+    def somar(rubrica, categoria, valor, qtd):
+        if qtd:
+            livro[(rubrica, categoria)][0] += _dec(valor)
+            livro[(rubrica, categoria)][1] += int(qtd)
+
+    d = Despesa.__table__
+    recorrente = d.c.recorrente.is_(True)
+    for cat, total, qtd, total_rec, qtd_rec in conn.execute(
+        select(func.coalesce(d.c.categoria, ""), func.sum(d.c.valor), func.count(d.c.id),
+               func.sum(case((recorrente, d.c.valor), else_=0)), func.sum(case((recorrente, 1), else_=0)))
+        .where(d.c.estabelecimento_id == estabelecimento_id, filtro_periodo(d.c.data_despesa, inicio, fim))
+        .group_by(func.coalesce(d.c.categoria, ""))
+    ):
+        somar(DESPESA, _categoria(cat), total, qtd)
+        somar(DESPESA_RECORRENTE, _categoria(cat), total_rec, qtd_rec)
+
+    c = ContaPagar.__table__
+    somar(PAGAR_ABERTO, "", *conn.execute(
+        select(func.sum(c.c.valor_atual - func.coalesce(c.c.valor_pago, 0)), func.count(c.c.id))
+        .where(c.c.estabelecimento_id == estabelecimento_id, filtro_periodo(c.c.data_vencimento, inicio, fim),
+               c.c.status.in_(STATUS_PAGAR_ABERTO))
+    ).one())
+    somar(PAGAR_PAGO, "", *conn.execute(
+        select(func.sum(func.coalesce(c.c.valor_pago, 0)), func.count(c.c.id))
+        .where(c.c.estabelecimento_id == estabelecimento_id, filtro_periodo(c.c.data_pagamento, inicio, fim),
+               c.c.status.in_(STATUS_PAGAR_PAGO))
+    ).one())
+
+    r = ContaReceber.__table__
+    somar(RECEBER_ABERTO, "", *conn.execute(
+        select(func.sum(r.c.valor_atual), func.count(r.c.id))
+        .where(r.c.estabelecimento_id == estabelecimento_id, filtro_periodo(r.c.data_vencimento, inicio, fim),
+               r.c.status.in_(STATUS_RECEBER_ABERTO))
+    ).one())
+    somar(RECEBER_RECEBIDO, "", *conn.execute(
+        select(func.sum(func.coalesce(r.c.valor_recebido, 0)), func.count(r.c.id))
+        .where(r.c.estabelecimento_id == estabelecimento_id, filtro_periodo(r.c.data_recebimento, inicio, fim),
+               or_(r.c.status.is_(None), r.c.status != "cancelado"))
+    ).one())
+
+    v = Venda.__table__
+    vendas_do_mes = and_(v.c.estabelecimento_id == estabelecimento_id, filtro_periodo(v.c.data_venda, inicio, fim),
+                         v.c.status != "cancelada", v.c.deleted_at.is_(None))
+    total, qtd, recebido = conn.execute(
+        select(func.sum(v.c.total), func.count(v.c.id), func.sum(func.coalesce(v.c.valor_recebido, 0)))
+        .where(vendas_do_mes)
+    ).one()
+    somar(RECEITA, "", total, qtd)
+    somar(VENDAS_RECEBIDO, "", recebido, qtd)
+    custo, i, p = _custo_itens()
+    somar(CMV, "", conn.execute(
+        select(custo).select_from(i.join(v, v.c.id == i.c.venda_id).outerjoin(p, p.c.id == i.c.produto_id))
+        .where(vendas_do_mes, *janela_particionada(VendaItem, *intervalo_utc(inicio, fim)))
+    ).scalar(), qtd)
+    return dict(livro)
+
+
+class FinanceiroMensalService:
+
+    @staticmethod
+    def contribuicoes(ids: Dict[str, Iterable[int]], connection) -> Dict[tuple, list]:
+        """
+        Contribuição atual das linhas informadas ao razão.
+
+        Args:
+            ids: {"despesas"|"contas_pagar"|"contas_receber"|"vendas": ids}.
+            connection: conexão da transação corrente (os listeners de flush passam session.connection()).
+
+        Returns:
+            {(estabelecimento_id, competência, rubrica, categoria): [valor, quantidade]}
+        """
+        total = defaultdict(lambda: [_ZERO, 0])
+        for fonte, fonte_ids in ids.items():
+            lista = sorted(fonte_ids)
+            for inicio in range(0, len(lista), _LOTE_IDS):
+                for chave, valor, qtd in _POR_ID[fonte](connection, lista[inicio:inicio + _LOTE_IDS]):
+                    total[chave][0] += valor
+                    total[chave][1] += qtd
+        return dict(total)
+
+    @staticmethod
+    def aplicar_deltas(antes: Dict[tuple, list], depois: Dict[tuple, list], connection) -> int:
+        """Soma (depois − antes) no razão; devolve quantas linhas mudaram."""
+        alteradas = 0
+        for chave in set(antes) | set(depois):
+            va, qa = antes.get(chave, (_ZERO, 0))
+            vd, qd = depois.get(chave, (_ZERO, 0))
+            if vd != va or qd != qa:
+                _acumular(connection, *chave, vd - va, qd - qa)
+                alteradas += 1
+        return alteradas
+
+    @staticmethod
+    def ler(estabelecimento_id: int, inicio: date = None, fim: date = None) -> RazaoMensal:
+        """Razão das competências inicio..fim (None = sem limite) numa consulta pelo
+        índice único. 'all' (visão da plataforma) soma o razão de todas as lojas.
+
+        Loja ainda não reconciliada (após a migração): os meses saem na hora das
+        tabelas de origem, sem gravar — a reconstrução é do agendador ou do CLI
+        (reconciliar-financeiro)."""
+        f = FinanceiroMensal.__table__
+        filtros = [f.c.rubrica != RECONCILIADO]
+        if estabelecimento_id == "all":
+            lojas = db.session.execute(select(Estabelecimento.id)).scalars().all()
+        else:
+            lojas = [estabelecimento_id]
+            filtros.append(f.c.estabelecimento_id == estabelecimento_id)
+        pendentes = [e for e in lojas if not FinanceiroMensalService._reconciliado(e)]
+        if pendentes:
+            filtros.append(f.c.estabelecimento_id.notin_(pendentes))
+        if inicio is not None:
+            filtros.append(f.c.competencia >= inicio.replace(day=1))
+        if fim is not None:
+            filtros.append(f.c.competencia <= fim.replace(day=1))
+
+        linhas = defaultdict(lambda: (_ZERO, 0))
+
+        def somar(chave, valor, qtd):
+            atual = linhas[chave]
+            linhas[chave] = (atual[0] + valor, atual[1] + qtd)
+
+        for r in db.session.execute(
+                select(f.c.competencia, f.c.rubrica, f.c.categoria, f.c.valor, f.c.quantidade).where(*filtros)):
+            somar((r.competencia, r.rubrica, r.categoria), _dec(r.valor), int(r.quantidade or 0))
+        for estab_id in pendentes:
+            for chave, (valor, qtd) in FinanceiroMensalService._ao_vivo(estab_id, inicio, fim).items():
+                somar(chave, valor, qtd)
+        return RazaoMensal(dict(linhas))
+
+    @staticmethod
+    def _ao_vivo(estabelecimento_id: int, inicio: date = None, fim: date = None) -> Dict[tuple, tuple]:
+        """Linhas do razão calculadas das tabelas de origem (sem folha), sem gravar."""
+        extensao = FinanceiroMensalService._extensao(estabelecimento_id)
+        if not extensao:
+            return {}
+        inicio = max(inicio.replace(day=1), extensao[0].replace(day=1)) if inicio else extensao[0]
+        fim = min(fim, extensao[1]) if fim else extensao[1]
+        conn = db.session.connection()
+        return {
+            (mes, rubrica, categoria): (valor, qtd)
+            for mes in meses_entre(inicio, fim)
+            for (rubrica, categoria), (valor, qtd) in _livro_do_mes(conn, estabelecimento_id, mes).items()
+        }
+
+    @staticmethod
+    def folha(estabelecimento_id: int, meses: List[date], razao: RazaoMensal = None) -> Dict[date, Decimal]:
+        """
+        Custo real da folha por competência. Meses fechados vêm do razão (gravados
+        pela reconciliação); os que faltam, o mês corrente e os futuros são
+        calculados na hora numa chamada, sem gravar.
+        """
+        from app.services.rh_calculator_service import calcular_custo_folha_periodos
+
+        corrente = hoje_local().replace(day=1)
+        razao = razao if razao is not None else FinanceiroMensalService.ler(
+            estabelecimento_id, min(meses), max(meses)) if meses else RazaoMensal({})
+        resultado = {} if estabelecimento_id == "all" else {
+            m: razao.valor(FOLHA, [m]) for m in meses if m < corrente and razao.tem(FOLHA, m)}
+        faltando = [m for m in meses if m not in resultado]
+        if not faltando:
+            return resultado
+        calculados = calcular_custo_folha_periodos(estabelecimento_id, [(m, fim_do_mes(m)) for m in faltando])
+        for m, dados in zip(faltando, calculados):
+            resultado[m] = _dec(dados["custo_folha"].get("custo_real_total", 0.0))
+        return resultado
+
+    @staticmethod
+    def custo_folha(estabelecimento_id: int, inicio: date, fim: date) -> Decimal:
+        """Custo da folha no período: soma dos meses fechados pelo razão quando o
+        período é de meses inteiros e já fechados; senão, calculado na hora."""
+        from app.services.rh_calculator_service import calcular_custo_folha_detalhado
+
+        meses = meses_inteiros(inicio, fim)
+        if meses and fim_do_mes(meses[-1]) < hoje_local():
+            return sum(FinanceiroMensalService.folha(estabelecimento_id, meses).values(), _ZERO)
+        dados = calcular_custo_folha_detalhado(estabelecimento_id, inicio, fim)
+        return _dec(dados.get("custo_folha", {}).get("custo_real_total", 0.0))
+
+    @staticmethod
+    def _gravar_folha(estabelecimento_id: int, valores: Dict[date, Decimal]) -> None:
+        f = FinanceiroMensal.__table__
+        db.session.execute(f.delete().where(f.c.estabelecimento_id == estabelecimento_id, f.c.rubrica == FOLHA,
+                                            f.c.competencia.in_(list(valores))))
+        db.session.execute(f.insert(), [
+            {"estabelecimento_id": estabelecimento_id, "competencia": m, "rubrica": FOLHA, "categoria": "",
+             "valor": v, "quantidade": 1, "atualizado_em": utcnow()}
+            for m, v in valores.items()
+        ])
+
+    @staticmethod
+    def reconciliar(estabelecimento_id: int, meses: List[date], corrigir: bool = True,
+                    incluir_folha: bool = True) -> Dict:
+        """
+        Confere o razão das competências informadas contra as tabelas de origem.
+
+        Args:
+            estabelecimento_id: loja a conferir.
+            meses: competências (1º dia do mês).
+            corrigir: se True, regrava os meses divergentes (e a marca de reconciliação) e confirma a transação.
+            incluir_folha: recalcula também a folha dos meses fechados.
+
+        Returns:
+            {"consistente": bool, "divergencias": [...], "corrigido": bool, "meses": int}
+        """
+        f = FinanceiroMensal.__table__
+        conn = db.session.connection()
+        meses = sorted({m.replace(day=1) for m in meses})
+        persistidos = defaultdict(dict)
+        for r in conn.execute(select(f.c.competencia, f.c.rubrica, f.c.categoria, f.c.valor, f.c.quantidade).where(
+                f.c.estabelecimento_id == estabelecimento_id, f.c.competencia.in_(meses),
+                f.c.rubrica.notin_((FOLHA, RECONCILIADO)))):
+            persistidos[r.competencia][(r.rubrica, r.categoria)] = (_dec(r.valor), int(r.quantidade or 0))
+
+        divergencias, livros = [], {}
+        for mes in meses:
+            livros[mes] = livro = _livro_do_mes(conn, estabelecimento_id, mes)
+            atual = persistidos.get(mes, {})
+            for chave in sorted(set(livro) | set(atual)):
+                esperado, gravado = livro.get(chave, (_ZERO, 0)), atual.get(chave, (_ZERO, 0))
+                if esperado[1] != gravado[1] or abs(esperado[0] - gravado[0]) > _TOLERANCIA:
+                    divergencias.append({
+                        "competencia": mes.isoformat(), "rubrica": chave[0], "categoria": chave[1],
+                        "origem": {"valor": float(esperado[0]), "quantidade": esperado[1]},
+                        "razao": {"valor": float(gravado[0]), "quantidade": gravado[1]},
+                    })
+        if divergencias:
+            logger.warning(f"Razão financeiro do estabelecimento {estabelecimento_id}: "
+                           f"{len(divergencias)} divergência(s) com as tabelas de origem.")
+        if not corrigir:
+            return {"consistente": not divergencias, "divergencias": divergencias, "corrigido": False,
+                    "meses": len(meses)}
+
+        agora = utcnow()
+        if meses:
+            conn.execute(f.delete().where(f.c.estabelecimento_id == estabelecimento_id, f.c.competencia.in_(meses),
+                                          f.c.rubrica != FOLHA))
+            conn.execute(f.insert(), [
+                {"estabelecimento_id": estabelecimento_id, "competencia": mes, "rubrica": rubrica,
+                 "categoria": categoria, "valor": valor, "quantidade": qtd, "atualizado_em": agora}
+                for mes, livro in livros.items() for (rubrica, categoria), (valor, qtd) in livro.items()
+            ] + [
+                {"estabelecimento_id": estabelecimento_id, "competencia": mes, "rubrica": RECONCILIADO,
+                 "categoria": "", "valor": 0, "quantidade": 0, "atualizado_em": agora}
+                for mes in meses
+            ])
+        if incluir_folha:
+            from app.services.rh_calculator_service import calcular_custo_folha_periodos
+            fechados = [m for m in meses if m < hoje_local().replace(day=1)]
+            if fechados:
+                calculados = calcular_custo_folha_periodos(estabelecimento_id, [(m, fim_do_mes(m)) for m in fechados])
+                FinanceiroMensalService._gravar_folha(estabelecimento_id, {
+                    m: _dec(d["custo_folha"].get("custo_real_total", 0.0)) for m, d in zip(fechados, calculados)})
+        db.session.commit()
+        return {"consistente": not divergencias, "divergencias": divergencias, "corrigido": bool(divergencias),
+                "meses": len(meses)}
+
+    @staticmethod
+    def _extensao(estabelecimento_id: int) -> Optional[tuple]:
+        """(primeira, última) data com lançamento em qualquer tabela de origem da loja."""
+        datas = []
+        for coluna in (Despesa.data_despesa, ContaPagar.data_vencimento, ContaPagar.data_pagamento,
+                       ContaReceber.data_vencimento, ContaReceber.data_recebimento, Venda.data_venda):
+            tabela = coluna.class_.__table__
+            datas.extend(d for d in db.session.execute(
+                select(func.min(tabela.c[coluna.key]), func.max(tabela.c[coluna.key]))
+                .where(tabela.c.estabelecimento_id == estabelecimento_id)
+            ).one() if d is not None)
+        if not datas:
+            return None
+        dias = [to_local(d).date() if isinstance(d, datetime) else d for d in datas]
+        return min(dias), max(dias)
+
+    @staticmethod
+    def reconciliar_estabelecimento(estabelecimento_id: int) -> Dict:
+        """Reconstrói o razão de todos os meses com lançamentos da loja."""
+        extensao = FinanceiroMensalService._extensao(estabelecimento_id)
+        meses = meses_entre(*extensao) if extensao else [hoje_local().replace(day=1)]
+        resultado = FinanceiroMensalService.reconciliar(estabelecimento_id, meses)
+        with _lock:
+            _verificados.add(int(estabelecimento_id))
+        return resultado
+
+    @staticmethod
+    def _meses_futuros(estabelecimento_id: int) -> List[date]:
+        """Competências depois da corrente com lançamento: contas em aberto por
+        vencimento e despesas agendadas."""
+        corrente = hoje_local().replace(day=1)
+        proximo = fim_do_mes(corrente) + timedelta(days=1)
+        datas = []
+        for coluna, abertos in ((ContaPagar.data_vencimento, STATUS_PAGAR_ABERTO),
+                                (ContaReceber.data_vencimento, STATUS_RECEBER_ABERTO),
+                                (Despesa.data_despesa, None)):
+            tabela = coluna.class_.__table__
+            filtros = [tabela.c.estabelecimento_id == estabelecimento_id, tabela.c[coluna.key] >= proximo]
+            if abertos:
+                filtros.append(tabela.c.status.in_(abertos))
+            ultima = db.session.execute(select(func.max(tabela.c[coluna.key])).where(*filtros)).scalar()
+            if ultima is not None:
+                datas.append(ultima)
+        return meses_entre(proximo, max(datas)) if datas else []
+
+    @staticmethod
+    def reconciliar_recentes(meses: int = 2) -> Dict[int, Dict]:
+        """Acerto noturno: os últimos ``meses`` (corrente incluso) de cada estabelecimento
+        e os meses futuros com contas em aberto ou despesas agendadas."""
+        corrente = hoje_local().replace(day=1)
+        competencias = meses_entre((corrente - timedelta(days=31 * (meses - 1))).replace(day=1), corrente)[-meses:]
+        resultado = {}
+        for estab_id in db.session.execute(select(Estabelecimento.id)).scalars().all():
+            try:
+                if not FinanceiroMensalService._reconciliado(estab_id):
+                    resultado[estab_id] = FinanceiroMensalService.reconciliar_estabelecimento(estab_id)
+                else:
+                    resultado[estab_id] = FinanceiroMensalService.reconciliar(
+                        estab_id, competencias + FinanceiroMensalService._meses_futuros(estab_id))
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Erro ao reconciliar o razão financeiro do estabelecimento {estab_id}: {e}")
+        return resultado
+
+    @staticmethod
+    def _reconciliado(estabelecimento_id: int) -> bool:
+        """A loja já teve o razão reconstruído (marca RECONCILIADO)? O sim fica em cache no processo."""
+        estab_id = int(estabelecimento_id)
+        if estab_id in _verificados:
+            return True
+        f = FinanceiroMensal.__table__
+        reconciliado = db.session.execute(
+            select(f.c.id).where(f.c.estabelecimento_id == estab_id, f.c.rubrica == RECONCILIADO).limit(1)
+        ).first() is not None
+        if reconciliado:
+            with _lock:
+                _verificados.add(estab_id)
+        return reconciliado
+
+    @staticmethod
+    def invalidar(estabelecimento_id=None) -> None:
+        """Esquece o cache de lojas reconciliadas (a próxima leitura reconfere a marca)."""
+        with _lock:
+            if estabelecimento_id is None:
+                _verificados.clear()
+            else:
+                _verificados.discard(int(estabelecimento_id))
+
+    @staticmethod
+    def comparativo(estabelecimento_id: int, meses: int = 12) -> List[Dict]:
+        """Série mensal das rubricas com a variação sobre o mês anterior (consulta de dicionário)."""
+        corrente = hoje_local().replace(day=1)
+        competencias = meses_entre((corrente - timedelta(days=31 * meses)).replace(day=1), corrente)[-(meses + 1):]
+        razao = FinanceiroMensalService.ler(estabelecimento_id, competencias[0], corrente)
+        folha = FinanceiroMensalService.folha(estabelecimento_id, competencias, razao)
+
+        def totais(m):
+            vendas = razao.vendas([m])
+            return {
+                "receita": vendas["revenue"], "cmv": vendas["cogs"], "lucro_bruto": vendas["gross_profit"],
+                "quantidade_vendas": vendas["count"],
+                "despesas": float(razao.valor(DESPESA, [m], CATEGORIAS_INTEGRADAS)),
+                "folha": float(folha.get(m, _ZERO)),
+                "contas_pagar_pagas": float(razao.valor(PAGAR_PAGO, [m])),
+                "contas_pagar_em_aberto": float(razao.valor(PAGAR_ABERTO, [m])),
+                "contas_receber_recebidas": float(razao.valor(RECEBER_RECEBIDO, [m])),
+                "contas_receber_em_aberto": float(razao.valor(RECEBER_ABERTO, [m])),
+            }
+
+        por_mes = {m: totais(m) for m in competencias}
+        serie = []
+        for anterior, m in zip(competencias, competencias[1:]):
+            atual, antes = por_mes[m], por_mes[anterior]
+            serie.append({
+                "mes": m.strftime("%Y-%m"),
+                "totais": atual,
+                "variacao_percentual": {
+                    k: (round((v - antes[k]) / antes[k] * 100, 1) if antes[k] else (100.0 if v else 0.0))
+                    for k, v in atual.items()
+                },
+            })
+        return serie
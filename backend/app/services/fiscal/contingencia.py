@@ -0,0 +1,252 @@
+"""
+Transmissão em lote dos documentos emitidos em contingência.
+
+Quando o gateway fiscal cai (disjuntor SaudeGateway aberto ou falha de
+comunicação), a NFC-e sai com chave local tpEmis 9 e fica com status
+"contingencia" em documentos_fiscais. Este módulo:
+
+- `ContingenciaService.transmitir`: assim que o gateway volta, envia os
+  documentos em contingência mais antigos primeiro, com concorrência limitada;
+- `ContingenciaService.consultar_pendentes`: consulta em lote (uma chamada
+  consultar_lote por estabelecimento) os documentos que o gateway devolveu
+  como "processando", em vez de uma consulta por documento a cada ciclo;
+- `ContingenciaService.metricas`: profundidade da fila, vazão recente e
+  estimativa de tempo para zerar a contingência (exposto em GET /api/fiscal/fila).
+
+Roda no ciclo dos workers da fila (fila_emissao.FilaEmissaoWorker), pela CLI
+`flask transmitir-contingencia` ou por POST /api/fiscal/contingencia/transmitir.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy import func, or_, select
+
+from app.models import db, DocumentoFiscal, Estabelecimento, Venda, utcnow
+from app.services.fiscal import emissao_service
+from app.services.fiscal.fila_emissao import FilaEmissaoNFCe, _LEASE_SEC, _notificar, backoff
+from app.services.fiscal.gateways import get_gateway, SaudeGateway
+
+logger = logging.getLogger(__name__)
+
+_CONCORRENCIA = int(os.getenv("NFCE_CONTINGENCIA_CONCORRENCIA", "4"))
+_LOTE = int(os.getenv("NFCE_CONTINGENCIA_LOTE", "200"))
+_BACKOFF_MAX = 300.0  # contingência não desiste: tenta no máximo a cada 5 min
+_JANELA_VAZAO_SEC = 300.0
+
+# Instantes (monotônicos) das transmissões concluídas neste processo — base da vazão.
+_concluidos: deque = deque(maxlen=10000)
+_concluidos_lock = threading.Lock()
+
+
+def _registrar_conclusao(qtd: int = 1) -> None:
+    agora = time.monotonic()
+    with _concluidos_lock:
+        _concluidos.extend([agora] * qtd)
+
+
+def _vazao_por_minuto() -> float:
+    """Documentos concluídos por minuto na janela recente (0 sem histórico)."""
+    agora = time.monotonic()
+    with _concluidos_lock:
+        while _concluidos and agora - _concluidos[0] > _JANELA_VAZAO_SEC:
+            _concluidos.popleft()
+        if len(_concluidos) < 2:
+            return 0.0
+        intervalo = max(1.0, agora - _concluidos[0])
+        return round(len(_concluidos) * 60.0 / intervalo, 1)
+
+
+def _vencidos(t):
+    return or_(t.c.proxima_tentativa_em.is_(None), t.c.proxima_tentativa_em <= utcnow())
+
+
+class ContingenciaService:
+
+    @staticmethod
+    def transmitir(estab_id: Optional[int] = None, limite: int = _LOTE,
+                   concorrencia: int = _CONCORRENCIA) -> Dict[str, Any]:
+        """Envia os documentos em contingência vencidos cujo gateway está disponível.
+
+        concorrencia > 1 usa um pool de threads (cada uma com seu app context e
+        sessão); concorrencia <= 1 — ou SQLite, cujas conexões não aguentam
+        escritas paralelas — transmite em sequência na sessão atual."""
+        inicio = time.monotonic()
+        t, e = DocumentoFiscal.__table__, Estabelecimento.__table__
+        consulta = (
+            select(t.c.id, e.c.fiscal_gateway, e.c.fiscal_ambiente)
+            .join(e, e.c.id == t.c.estabelecimento_id)
+            .where(t.c.status == "contingencia", _vencidos(t))
+            .order_by(t.c.contingencia_em, t.c.id)
+            .limit(limite)
+        )
+        if estab_id is not None:
+            consulta = consulta.where(t.c.estabelecimento_id == estab_id)
+        linhas = db.session.execute(consulta).all()
+        db.session.rollback()  # encerra a leitura antes de abrir conexões nas threads
+
+        ids = [
+            doc_id for doc_id, gw, amb in linhas
+            if SaudeGateway.disponivel(f"{(gw or 'simulado').lower()}:{amb or 'homologacao'}")
+        ]
+        if db.session.get_bind().dialect.name == "sqlite":
+            concorrencia = 1
+        if concorrencia <= 1 or len(ids) <= 1:
+            resultados = [ContingenciaService._transmitir_um(doc_id) for doc_id in ids]
+        else:
+            app = current_app._get_current_object()
+
+            def _no_contexto(doc_id):
+                with app.app_context():
+                    try:
+                        return ContingenciaService._transmitir_um(doc_id)
+                    finally:
+                        db.session.remove()
+
+            with ThreadPoolExecutor(max_workers=min(concorrencia, len(ids))) as executor:
+                resultados = list(executor.map(_no_contexto, ids))
+
+        por_status: Dict[str, int] = defaultdict(int)
+        for status in resultados:
+            if status:
+                por_status[status] += 1
+        if ids:
+            logger.info(f"[CONTINGÊNCIA] {len(ids)} documento(s) transmitido(s): {dict(por_status)}")
+        return {
+            "enviados": sum(por_status.values()),
+            "por_status": dict(por_status),
+            "duracao_seg": round(time.monotonic() - inicio, 3),
+        }
+
+    @staticmethod
+    def _transmitir_um(doc_id: int) -> Optional[str]:
+        """Reivindica e transmite um documento em contingência. Commita."""
+        if not FilaEmissaoNFCe._reivindicar(doc_id):
+            return None  # outro worker levou
+        try:
+            doc = db.session.get(DocumentoFiscal, doc_id)
+            estab = db.session.get(Estabelecimento, doc.estabelecimento_id)
+            venda = db.session.get(Venda, doc.venda_id)
+            try:
+                resp = emissao_service.transmitir_nfce(doc, venda, estab)
+            except Exception as e:
+                resp = {"status": "erro", "mensagem": f"Falha de comunicação com o gateway: {e}"}
+
+            if resp.get("status") == "erro":
+                # Continua em contingência (a chave local já está no cupom): nova tentativa depois
+                doc.motivo_rejeicao = str(resp.get("mensagem"))
+                doc.proxima_tentativa_em = utcnow() + timedelta(seconds=min(_BACKOFF_MAX, backoff(doc.tentativas)))
+            else:
+                emissao_service.aplicar_resposta(doc, resp)
+                if doc.status == "processando":
+                    doc.tentativas = 0  # a contagem passa a ser das consultas
+                    doc.proxima_tentativa_em = utcnow() + timedelta(seconds=backoff(1))
+                else:
+                    doc.proxima_tentativa_em = None
+                    _registrar_conclusao()
+            db.session.commit()
+            _notificar()
+            return doc.status
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[CONTINGÊNCIA] Documento {doc_id}: {e}")
+            return None
+
+    @staticmethod
+    def consultar_pendentes(limite: int = _LOTE) -> Dict[int, str]:
+        """Consulta em lote os documentos "processando" vencidos: uma chamada
+        consultar_lote por estabelecimento. Retorna {doc_id: status}."""
+        t = DocumentoFiscal.__table__
+        linhas = db.session.execute(
+            select(t.c.id, t.c.estabelecimento_id)
+            .where(t.c.status == "processando", t.c.proxima_tentativa_em.isnot(None), _vencidos(t))
+            .order_by(t.c.proxima_tentativa_em, t.c.id)
+            .limit(limite)
+        ).all()
+        grupos: Dict[int, List[int]] = defaultdict(list)
+        for doc_id, estab_id in linhas:
+            grupos[estab_id].append(doc_id)
+
+        resultado: Dict[int, str] = {}
+        for estab_id, ids in grupos.items():
+            estab = db.session.get(Estabelecimento, estab_id)
+            chave = SaudeGateway.chave(estab)
+            if not SaudeGateway.disponivel(chave):
+                continue
+
+            # Reivindica o grupo inteiro num UPDATE só (lease) antes de ir à rede
+            agora = utcnow()
+            reivindicados = db.session.execute(
+                t.update()
+                .where(t.c.id.in_(ids), t.c.status == "processando", _vencidos(t))
+                .values(proxima_tentativa_em=agora + timedelta(seconds=_LEASE_SEC),
+                        tentativas=t.c.tentativas + 1)
+                .returning(t.c.id)
+            ).scalars().all()
+            db.session.commit()
+            if not reivindicados:
+                continue
+
+            docs = db.session.execute(
+                select(DocumentoFiscal).where(DocumentoFiscal.id.in_(reivindicados))
+            ).scalars().all()
+            try:
+                respostas = get_gateway(estab).consultar_lote([d.referencia for d in docs])
+            except Exception as e:
+                SaudeGateway.registrar_falha(chave)
+                logger.error(f"[CONTINGÊNCIA] Consulta em lote (estab {estab_id}): {e}")
+                continue  # o lease expira e o grupo volta a ser consultado
+            SaudeGateway.registrar_sucesso(chave)
+
+            for doc in docs:
+                resp = respostas.get(doc.referencia) or {"status": "processando"}
+                if resp.get("status") in ("processando", "erro"):
+                    # Ainda na SEFAZ (ou consulta falhou): nunca vira "erro" — a nota pode autorizar
+                    doc.proxima_tentativa_em = utcnow() + timedelta(
+                        seconds=min(_BACKOFF_MAX, backoff(doc.tentativas)))
+                else:
+                    emissao_service.aplicar_resposta(doc, resp)
+                    doc.proxima_tentativa_em = None
+                    _registrar_conclusao()
+                resultado[doc.id] = doc.status
+            db.session.commit()
+            _notificar()
+        return resultado
+
+    @staticmethod
+    def metricas(estab_id: int, contagem: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """Profundidade, vazão e estimativa de drenagem da contingência do estabelecimento.
+
+        A vazão é medida neste processo (janela de 5 min); com vários processos,
+        cada um reporta a própria."""
+        t = DocumentoFiscal.__table__
+        if contagem is None:
+            contagem = dict(db.session.execute(
+                select(t.c.status, func.count(t.c.id))
+                .where(t.c.estabelecimento_id == estab_id, t.c.status.in_(("contingencia", "processando")))
+                .group_by(t.c.status)
+            ).all())
+        mais_antiga = db.session.execute(
+            select(func.min(t.c.contingencia_em))
+            .where(t.c.estabelecimento_id == estab_id, t.c.status == "contingencia")
+        ).scalar()
+        pendentes = contagem.get("contingencia", 0) + contagem.get("processando", 0)
+        vazao = _vazao_por_minuto()
+        if not pendentes:
+            estimativa = 0
+        else:
+            estimativa = round(pendentes * 60.0 / vazao) if vazao else None  # sem vazão medida ainda
+        return {
+            "contingencia_mais_antiga": mais_antiga.isoformat() if mais_antiga else None,
+            "vazao_por_minuto": vazao,
+            "estimativa_drenagem_seg": estimativa,
+            "gateways": SaudeGateway.situacao(),
+        }
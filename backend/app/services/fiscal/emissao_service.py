@@ -2,7 +2,9 @@
 Serviço de emissão de NFC-e (modelo 65) — Simples Nacional (CSOSN).
 
 Monta o payload a partir da Venda e emite via gateway (factory get_gateway).
-Persiste o DocumentoFiscal e controla a numeração por estabelecimento.
+Persiste o DocumentoFiscal; a numeração vem de NumeracaoFiscalService
+(sequência atômica por estabelecimento/série) e o envio do PDV passa pela
+fila de emissão (fila_emissao).
 
 Observação de responsabilidade: os defaults tributários (CSOSN 102, CFOP 5102,
 PIS/COFINS 49) cobrem o caso típico de mercadinho no Simples revendendo
@@ -13,10 +15,11 @@ from __future__ import annotations
 import re
 from datetime import datetime
 from decimal import Decimal
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Tuple
 
 from app.models import db, Venda, DocumentoFiscal, Estabelecimento, utcnow
-from app.services.fiscal.gateways import get_gateway, SimuladoGateway
+from app.services.fiscal.gateways import get_gateway, gerar_chave_acesso, SaudeGateway, SimuladoGateway, UF_IBGE
+from app.services.fiscal.numeracao_service import NumeracaoFiscalService
 
 # Mapa forma de pagamento (interno → código Focus NFe / SEFAZ)
 FORMA_PGTO_COD = {
@@ -111,7 +114,9 @@ def _validar_cadastro_fiscal_producao(venda: Venda, estab: Estabelecimento) -> N
         )
 
 
-def _build_payload(venda: Venda, estab: Estabelecimento, numero: int, serie: int) -> Dict[str, Any]:
+def _build_payload(venda: Venda, estab: Estabelecimento, numero: int, serie: int,
+                   contingencia_em: Optional[datetime] = None,
+                   chave_contingencia: Optional[str] = None) -> Dict[str, Any]:
     itens = []
     for i, item in enumerate(venda.itens, start=1):
         prod = item.produto
@@ -157,7 +162,7 @@ def _build_payload(venda: Venda, estab: Estabelecimento, numero: int, serie: int
     if not pagamentos:
         pagamentos.append({"forma_pagamento": "01", "valor_pagamento": round(float(venda.total or 0), 2)})
 
-    return {
+    payload = {
         "modelo": "65",
         "serie": serie,
         "numero": numero,
@@ -171,13 +176,36 @@ def _build_payload(venda: Venda, estab: Estabelecimento, numero: int, serie: int
         # Metadados usados pelo gateway simulado (prefixo _ é removido no envio real)
         "_emitente": {"cnpj": estab.cnpj, "uf": estab.estado, "nome": estab.razao_social},
     }
+    if contingencia_em:
+        # NFC-e emitida em contingência offline (tpEmis 9): transmitida depois, com a
+        # data/hora e a justificativa de entrada em contingência.
+        payload["forma_emissao"] = "9"
+        payload["data_entrada_contingencia"] = contingencia_em.strftime("%Y-%m-%dT%H:%M:%S-03:00")
+        payload["justificativa_contingencia"] = "Falha de comunicacao com o servidor de autorizacao"
+        if chave_contingencia:
+            # A chave já está no cupom impresso: o gateway tem de montar a mesma (cNF = posições 36-43)
+            payload["chave_nfe"] = chave_contingencia
+            payload["codigo_numerico"] = chave_contingencia[35:43]
+    return payload
 
 
 class EmissaoError(ValueError):
     pass
 
 
-def emitir_nfce(venda: Venda, estab: Estabelecimento, funcionario_id: int) -> DocumentoFiscal:
+STATUS_EM_ANDAMENTO = ("fila", "contingencia", "processando", "autorizado")
+
+
+def preparar_nfce(venda: Venda, estab: Estabelecimento, funcionario_id: int,
+                  status_inicial: str = "processando") -> Tuple[DocumentoFiscal, bool]:
+    """
+    Valida a venda, reserva o número (NumeracaoFiscalService) e cria/reaproveita
+    o DocumentoFiscal. Não fala com o gateway e não commita.
+
+    Returns:
+        (documento, preparado) — preparado=False quando já existe documento
+        autorizado/na fila/em processamento para a venda (idempotência).
+    """
     if venda.status != "finalizada":
         raise EmissaoError("Só é possível emitir NFC-e de vendas finalizadas.")
 
@@ -185,11 +213,10 @@ def emitir_nfce(venda: Venda, estab: Estabelecimento, funcionario_id: int) -> Do
     existente = DocumentoFiscal.query.filter_by(
         estabelecimento_id=estab.id, referencia=referencia
     ).first()
-    if existente and existente.status in ("autorizado", "processando"):
-        return existente  # idempotente: já emitido/em processamento
+    if existente and existente.status in STATUS_EM_ANDAMENTO:
+        return existente, False  # idempotente: já emitido/em processamento
 
     serie = int(getattr(estab, "serie_nfce", 1) or 1)
-    numero = int(getattr(estab, "proximo_numero_nfce", 1) or 1)
     ambiente = getattr(estab, "fiscal_ambiente", None) or "homologacao"
     gateway = get_gateway(estab)
     gw_nome = (getattr(estab, "fiscal_gateway", None) or "simulado").lower()
@@ -209,42 +236,132 @@ def emitir_nfce(venda: Venda, estab: Estabelecimento, funcionario_id: int) -> Do
         _validar_ncm_producao(venda)
         _validar_cadastro_fiscal_producao(venda, estab)
 
-    payload = _build_payload(venda, estab, numero, serie)
+    # Reemissão de documento rejeitado/com erro reaproveita o número já reservado.
+    if existente and existente.numero and str(existente.serie or serie) == str(serie):
+        numero = int(existente.numero)
+    else:
+        numero = NumeracaoFiscalService.reservar(estab, "65", serie)
 
     doc = existente or DocumentoFiscal(
         estabelecimento_id=estab.id, venda_id=venda.id, funcionario_id=funcionario_id,
-        tipo="nfce", modelo="65", ambiente=ambiente, gateway=gw_nome,
-        referencia=referencia, serie=str(serie), numero=str(numero),
-        valor_total=venda.total, status="processando",
+        tipo="nfce", modelo="65", referencia=referencia, valor_total=venda.total,
     )
+    doc.ambiente, doc.gateway = ambiente, gw_nome
+    doc.serie, doc.numero = str(serie), str(numero)
+    doc.status = status_inicial
+    doc.motivo_rejeicao = None
+    doc.tentativas = 0
+    doc.proxima_tentativa_em = utcnow() if status_inicial == "fila" else None
+    doc.contingencia_em = None
     if not existente:
         db.session.add(doc)
+    return doc, True
+
 
+def transmitir_nfce(doc: DocumentoFiscal, venda: Venda, estab: Estabelecimento) -> Dict[str, Any]:
+    """Envia o documento ao gateway (chamada bloqueante; pode levantar exceção de rede).
+    Alimenta o disjuntor SaudeGateway com o resultado da comunicação."""
+    payload = _build_payload(venda, estab, int(doc.numero), int(doc.serie or 1), doc.contingencia_em,
+                             doc.chave_acesso if doc.contingencia_em else None)
+    chave = SaudeGateway.chave(estab)
     try:
-        resp = gateway.emitir(payload, referencia)
-    except Exception as e:
+        resp = get_gateway(estab).emitir(payload, doc.referencia)
+    except Exception:
+        SaudeGateway.registrar_falha(chave)
+        raise
+    SaudeGateway.registrar_sucesso(chave)
+    return resp
+
+
+def consultar_apos_falha(doc: DocumentoFiscal, estab: Estabelecimento) -> Optional[Dict[str, Any]]:
+    """Falha de rede no envio não prova que a nota não chegou: o gateway pode tê-la
+    recebido e autorizado antes de a conexão cair. Consulta pela referência antes de
+    emitir em contingência — uma segunda nota (tpEmis 9) com o mesmo número seria
+    rejeitada por duplicidade. Devolve a resposta quando o gateway conhece a nota;
+    None quando não conhece ("erro", p.ex. 404) ou a consulta também falhou."""
+    try:
+        resp = get_gateway(estab).consultar(doc.referencia)
+    except Exception:
+        return None
+    return resp if resp.get("status") in ("autorizado", "rejeitado", "processando", "cancelado") else None
+
+
+def entrar_contingencia(doc: DocumentoFiscal, estab: Estabelecimento, motivo: str) -> None:
+    """Emite o documento em contingência offline: chave de acesso gerada localmente
+    (tpEmis 9) para o cupom sair na hora; o transmissor de contingência envia depois."""
+    agora = utcnow()
+    if not doc.contingencia_em:
+        doc.contingencia_em = agora
+        # AAMM da chave = mês da data de emissão enviada no payload
+        emissao = (doc.venda.data_venda if doc.venda else None) or agora
+        doc.chave_acesso = gerar_chave_acesso(
+            UF_IBGE.get((estab.estado or "").upper(), "35"), re.sub(r"\D", "", estab.cnpj or ""),
+            doc.modelo or "65", int(doc.serie or 1), int(doc.numero), tp_emis="9", data=emissao,
+        )
+    doc.status = "contingencia"
+    doc.motivo_rejeicao = motivo
+    doc.proxima_tentativa_em = agora
+
+
+def aplicar_resposta(doc: DocumentoFiscal, resp: Dict[str, Any]) -> None:
+    """Grava no documento o retorno normalizado do gateway (contrato de gateways.py)."""
+    chave = resp.get("chave")
+    if doc.contingencia_em and doc.chave_acesso and chave and chave != doc.chave_acesso:
+        # O cupom impresso traz a chave de contingência: uma nota com outra chave não é a
+        # mesma para o consumidor nem para a SEFAZ. Fica para tratamento manual, sem
+        # sobrescrever a chave nem liberar o número.
         doc.status = "erro"
-        doc.motivo_rejeicao = f"Falha de comunicação com o gateway: {e}"
-        db.session.commit()
-        return doc
-
+        doc.motivo_rejeicao = (f"Gateway devolveu a chave {chave}, diferente da chave de contingência "
+                               f"impressa {doc.chave_acesso}.")
+        return
     doc.status = resp.get("status", "processando")
-    doc.chave_acesso = resp.get("chave")
-    doc.protocolo = resp.get("protocolo")
-    doc.danfe_url = resp.get("danfe_url")
-    doc.xml_url = resp.get("xml_url")
-    doc.xml_content = resp.get("xml")
-    doc.qr_code = resp.get("qr_code")
+    doc.chave_acesso = chave or doc.chave_acesso
+    doc.protocolo = resp.get("protocolo") or doc.protocolo
+    doc.danfe_url = resp.get("danfe_url") or doc.danfe_url
+    doc.xml_url = resp.get("xml_url") or doc.xml_url
+    doc.xml_content = resp.get("xml") or doc.xml_content
+    doc.qr_code = resp.get("qr_code") or doc.qr_code
     if doc.status == "rejeitado" or doc.status == "erro":
         msg = resp.get("mensagem")
         doc.motivo_rejeicao = str(msg) if msg else "Rejeitado pela SEFAZ"
+    if doc.status == "rejeitado":
+        # Só a rejeição da SEFAZ libera o número. "erro" é falha de comunicação/HTTP:
+        # a nota pode ter sido recebida e o número segue no documento para a reemissão.
+        NumeracaoFiscalService.registrar_lacuna(doc, doc.motivo_rejeicao)
     if doc.status == "autorizado":
         doc.autorizado_em = utcnow()
+        doc.motivo_rejeicao = None
         if resp.get("numero"):
             doc.numero = str(resp["numero"])
-        # Avança a numeração do estabelecimento somente quando autoriza
-        estab.proximo_numero_nfce = numero + 1
+        NumeracaoFiscalService.resolver_lacuna(doc)
+
+
+def emitir_nfce(venda: Venda, estab: Estabelecimento, funcionario_id: int) -> DocumentoFiscal:
+    """Emissão síncrona (reemissão manual). O PDV usa a fila: app.services.fiscal.fila_emissao."""
+    doc, preparado = preparar_nfce(venda, estab, funcionario_id)
+    if not preparado:
+        return doc
+    if not SaudeGateway.disponivel(SaudeGateway.chave(estab)):
+        entrar_contingencia(doc, estab, "Gateway fiscal indisponível: emitida em contingência.")
+        db.session.commit()
+        return doc
+    # Commit antes da rede: o número fica gravado e a trava da série é liberada.
+    db.session.commit()
 
+    try:
+        resp = transmitir_nfce(doc, venda, estab)
+    except Exception as e:
+        # Sem resposta do gateway: se a nota não chegou, não se perde nem fica em
+        # "erro" esperando reenvio manual — vai para a contingência e o transmissor envia depois.
+        resp = consultar_apos_falha(doc, estab)
+        if resp is None:
+            entrar_contingencia(doc, estab, f"Falha de comunicação com o gateway: {e}")
+            db.session.commit()
+            return doc
+
+    if resp.get("status") == "erro":
+        resp = consultar_apos_falha(doc, estab) or resp
+    aplicar_resposta(doc, resp)
     db.session.commit()
     return doc
 
@@ -3,29 +3,49 @@ Serviço de importação de NF-e de entrada (compra).
 
 - preview(parsed, estab_id): mostra o que será importado (sem gravar nada).
 - importar(parsed, xml, estab_id, func_id, opcoes): efetiva a entrada.
+- importar_lote(zip_bytes, estab_id, func_id): várias notas de um ZIP (ex.: o mês
+  de notas de um fornecedor), lidas em paralelo e gravadas nota a nota.
 
 Responsabilidades ao importar:
 - Upsert do Fornecedor pelo CNPJ do emitente.
-- Para cada item: localiza o Produto (por EAN/código) ou cria um novo.
+- Localiza os Produtos de todos os itens de uma vez (um SELECT ... IN por EAN/código)
+  e cria os que faltam num único flush.
 - Dá entrada no estoque (Produto.quantidade + MovimentacaoEstoque) e recalcula o
-  custo médio ponderado (CMP), registrando no histórico de preços.
+  custo médio ponderado (CMP), registrando no histórico de preços — calculados
+  em memória e gravados num único flush do ORM (auditoria e fila de
+  sincronização incluídas), não uma instrução por item.
 - Gera Conta a Pagar (pelas duplicatas da nota ou pelo total).
 - Registra a NotaFiscalEntrada (idempotente pela chave de acesso) guardando o XML.
 """
 from __future__ import annotations
 
+import io
+import logging
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
 from decimal import Decimal, ROUND_HALF_UP
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
 
 from app.models import (
-    db, Produto, Fornecedor, CategoriaProduto, MovimentacaoEstoque,
+    db, Produto, Fornecedor, CategoriaProduto, MovimentacaoEstoque, HistoricoPrecos,
     ContaPagar, NotaFiscalEntrada, Estabelecimento, utcnow,
 )
-from app.services.catalogo_mestre_service import registrar_produto_se_novo
+from app.services.catalogo_mestre_service import registrar_produtos_se_novos
+from app.services.fiscal.xml_parser import parse_nfe_xml, XMLNotaError
+
+logger = logging.getLogger(__name__)
 
 CATEGORIA_IMPORTACAO = "Importação NF-e"
 
+LOTE_MAX_ARQUIVOS = 1000
+LOTE_MAX_XML_BYTES = 10 * 1024 * 1024  # por arquivo, descompactado
+_PARSE_WORKERS = int(os.getenv("NFE_LOTE_WORKERS", "4"))
+
 
 class ImportacaoError(ValueError):
     pass
@@ -43,17 +63,49 @@ def _parse_data(value: Optional[str]) -> Optional[datetime]:
     return None
 
 
-def _produto_existente(estab_id: int, ean: Optional[str], codigo: Optional[str]) -> Optional[Produto]:
-    q = Produto.query.filter(Produto.estabelecimento_id == estab_id)
-    if ean:
-        p = q.filter(Produto.codigo_barras == ean).first()
-        if p:
-            return p
-    if codigo:
-        p = q.filter(Produto.codigo_interno == codigo).first()
-        if p:
-            return p
-    return None
+class _IndiceProdutos:
+    """Produtos do estabelecimento casados por EAN (prioridade) ou código interno.
+
+    Um único SELECT ... IN para todos os itens da nota; produtos criados durante
+    a importação entram no índice para itens repetidos na mesma nota. Cada estado
+    guarda o objeto carregado em "produto", que recebe o resultado no fim."""
+
+    def __init__(self, estab_id: int, itens: List[Dict[str, Any]]):
+        self.por_ean: Dict[str, Dict[str, Any]] = {}
+        self.por_codigo: Dict[str, Dict[str, Any]] = {}
+        eans = {it["ean"] for it in itens if it.get("ean")}
+        codigos = {it["codigo"] for it in itens if it.get("codigo")}
+        if not eans and not codigos:
+            return
+        filtros = []
+        if eans:
+            filtros.append(Produto.codigo_barras.in_(eans))
+        if codigos:
+            filtros.append(Produto.codigo_interno.in_(codigos))
+        produtos = db.session.execute(
+            select(Produto)
+            .where(Produto.estabelecimento_id == estab_id, Produto.deleted_at.is_(None), or_(*filtros))
+            .order_by(Produto.id)
+        ).scalars().all()
+        for prod in produtos:
+            self.adicionar(_estado(prod))
+
+    def adicionar(self, prod: Dict[str, Any]) -> None:
+        # Em caso de EAN/código repetido no cadastro vale o produto mais antigo (como o .first() de antes)
+        if prod.get("codigo_barras"):
+            self.por_ean.setdefault(prod["codigo_barras"], prod)
+        if prod.get("codigo_interno"):
+            self.por_codigo.setdefault(prod["codigo_interno"], prod)
+
+    def buscar(self, ean: Optional[str], codigo: Optional[str]) -> Optional[Dict[str, Any]]:
+        return (self.por_ean.get(ean) if ean else None) or (self.por_codigo.get(codigo) if codigo else None)
+
+
+def _estado(prod: Produto) -> Dict[str, Any]:
+    return {"produto": prod, "id": prod.id, "nome": prod.nome, "codigo_barras": prod.codigo_barras,
+            "codigo_interno": prod.codigo_interno, "quantidade": prod.quantidade, "preco_custo": prod.preco_custo,
+            "preco_venda": prod.preco_venda, "margem_lucro": prod.margem_lucro,
+            "fornecedor_id": prod.fornecedor_id}
 
 
 def _get_or_create_categoria_importacao(estab_id: int) -> CategoriaProduto:
@@ -94,6 +146,26 @@ def _upsert_fornecedor(estab_id: int, emit: Dict[str, Any]) -> Optional[Forneced
     return forn
 
 
+def _aplicar_cmp(estado: Dict[str, Any], qtd: Decimal, custo_unit: Decimal, funcionario_id: int,
+                 motivo: str, estab_id: int, historicos: List[Dict[str, Any]]) -> None:
+    """Mesma regra de Produto.recalcular_preco_custo_ponderado, sobre o estado em memória."""
+    if int(qtd) <= 0:
+        return
+    custo_anterior = Decimal(str(estado["preco_custo"] or 0))
+    margem_anterior = Decimal(str(estado["margem_lucro"] or 0))
+    novo_custo = Produto.custo_medio_ponderado(int(estado["quantidade"] or 0), custo_anterior, int(qtd), custo_unit)
+    preco_venda = estado["preco_venda"]
+    estado["preco_custo"] = novo_custo
+    estado["margem_lucro"] = (preco_venda - novo_custo) / novo_custo * 100 if preco_venda and novo_custo > 0 else 0
+    if funcionario_id and abs(novo_custo - custo_anterior) > Decimal("0.01"):
+        historicos.append(dict(
+            estabelecimento_id=estab_id, produto_id=estado["id"], funcionario_id=funcionario_id,
+            preco_custo_anterior=custo_anterior, preco_venda_anterior=preco_venda, margem_anterior=margem_anterior,
+            preco_custo_novo=novo_custo, preco_venda_novo=preco_venda, margem_nova=estado["margem_lucro"],
+            motivo=motivo, observacoes=f"CMP recalculado: entrada de {int(qtd)} unidades a R$ {custo_unit}",
+        ))
+
+
 def preview(parsed: Dict[str, Any], estab_id: int) -> Dict[str, Any]:
     """Monta a prévia da importação sem gravar nada."""
     chave = parsed["chave_acesso"]
@@ -105,9 +177,10 @@ def preview(parsed: Dict[str, Any], estab_id: int) -> Dict[str, Any]:
         estabelecimento_id=estab_id, cnpj=parsed["emitente"]["cnpj"]
     ).first() if parsed["emitente"].get("cnpj") else None
 
+    indice = _IndiceProdutos(estab_id, parsed["itens"])
     itens_preview: List[Dict[str, Any]] = []
     for it in parsed["itens"]:
-        prod = _produto_existente(estab_id, it.get("ean"), it.get("codigo"))
+        prod = indice.buscar(it.get("ean"), it.get("codigo"))
         itens_preview.append({
             "descricao": it["descricao"],
             "ean": it["ean"],
@@ -117,8 +190,8 @@ def preview(parsed: Dict[str, Any], estab_id: int) -> Dict[str, Any]:
             "valor_unitario": float(it["valor_unitario"]),
             "valor_total": float(it["valor_total"]),
             "produto_existente": prod is not None,
-            "produto_id": prod.id if prod else None,
-            "produto_nome": prod.nome if prod else None,
+            "produto_id": prod["id"] if prod else None,
+            "produto_nome": prod["nome"] if prod else None,
             "acao": "atualizar_estoque" if prod else "criar_produto",
         })
 
@@ -146,63 +219,86 @@ def importar(parsed: Dict[str, Any], xml_text: str, estab_id: int, funcionario_i
         raise ImportacaoError("Esta nota já foi importada (chave de acesso duplicada).")
 
     forn = _upsert_fornecedor(estab_id, parsed["emitente"])
-    categoria = None
-    estabelecimento = Estabelecimento.query.get(estab_id)
+    estabelecimento = db.session.get(Estabelecimento, estab_id)
+    itens = parsed["itens"]
+    indice = _IndiceProdutos(estab_id, itens)
 
-    produtos_criados = 0
-    produtos_atualizados = 0
+    # 1) Produtos novos: criados todos num flush só (itens repetidos viram um produto)
+    novos: List[Tuple[Produto, Dict[str, Any]]] = []
+    estados: List[Dict[str, Any]] = []  # estado do produto de cada item
+    criados_em = set()  # posições dos itens que criaram produto
+    for pos, it in enumerate(itens):
+        estado = indice.buscar(it.get("ean"), it.get("codigo"))
+        if estado is not None:
+            estados.append(estado)
+            continue
+        if not novos:
+            categoria = _get_or_create_categoria_importacao(estab_id)
+        custo_unit = Decimal(str(it["valor_unitario"]))
+        preco_venda = (custo_unit * (1 + markup_padrao / 100)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        prod = Produto(
+            estabelecimento_id=estab_id,
+            categoria_id=categoria.id,
+            fornecedor_id=forn.id if forn else None,
+            codigo_barras=it.get("ean"),
+            codigo_interno=it.get("codigo"),
+            nome=(it["descricao"] or "Produto importado")[:100],
+            unidade_medida=(it.get("unidade") or "UN")[:20],
+            quantidade=Decimal("0"),
+            preco_custo=custo_unit,
+            preco_venda=preco_venda,
+            margem_lucro=markup_padrao,
+            ncm=it.get("ncm"),
+            cfop_padrao=it.get("cfop") or "5102",
+            cest=it.get("cest"),
+        )
+        estado = _estado(prod)
+        novos.append((prod, estado))
+        estados.append(estado)
+        criados_em.add(pos)
+        indice.adicionar(estado)
+    if novos:
+        db.session.add_all([prod for prod, _ in novos])
+        db.session.flush()
+        for prod, estado in novos:
+            estado["id"] = prod.id
+        registrar_produtos_se_novos([prod for prod, _ in novos], estabelecimento, via="xml")
 
-    for it in parsed["itens"]:
+    # 2) Estoque, CMP, movimentações e histórico calculados em memória, item a item
+    motivo_cmp = f"Entrada NF-e {parsed['numero']}"
+    movimentacoes: List[Dict[str, Any]] = []
+    historicos: List[Dict[str, Any]] = []
+    for pos, it in enumerate(itens):
         qtd = Decimal(str(it["quantidade"]))
         custo_unit = Decimal(str(it["valor_unitario"]))
-        prod = _produto_existente(estab_id, it.get("ean"), it.get("codigo"))
-
-        if prod is None:
-            if categoria is None:
-                categoria = _get_or_create_categoria_importacao(estab_id)
-            preco_venda = (custo_unit * (1 + markup_padrao / 100)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            prod = Produto(
-                estabelecimento_id=estab_id,
-                categoria_id=categoria.id,
-                fornecedor_id=forn.id if forn else None,
-                codigo_barras=it.get("ean"),
-                codigo_interno=it.get("codigo"),
-                nome=(it["descricao"] or "Produto importado")[:100],
-                unidade_medida=(it.get("unidade") or "UN")[:20],
-                quantidade=Decimal("0"),
-                preco_custo=custo_unit,
-                preco_venda=preco_venda,
-                margem_lucro=markup_padrao,
-                ncm=it.get("ncm"),
-                cfop_padrao=it.get("cfop") or "5102",
-                cest=it.get("cest"),
-            )
-            db.session.add(prod)
-            db.session.flush()
-            registrar_produto_se_novo(prod, estabelecimento, via="xml")
-            produtos_criados += 1
-        else:
-            # Recalcula custo médio ponderado e registra no histórico de preços
-            prod.recalcular_preco_custo_ponderado(
-                quantidade_entrada=int(qtd), custo_unitario_entrada=custo_unit,
-                registrar_historico=True, funcionario_id=funcionario_id,
-                motivo=f"Entrada NF-e {parsed['numero']}",
-            )
-            if forn and not prod.fornecedor_id:
-                prod.fornecedor_id = forn.id
-            produtos_atualizados += 1
-
-        # Entrada de estoque + movimentação
-        qtd_anterior = Decimal(str(prod.quantidade or 0))
-        prod.quantidade = qtd_anterior + qtd
-        db.session.add(MovimentacaoEstoque(
-            estabelecimento_id=estab_id, produto_id=prod.id, funcionario_id=funcionario_id,
+        estado = estados[pos]
+
+        if pos not in criados_em:
+            _aplicar_cmp(estado, qtd, custo_unit, funcionario_id, motivo_cmp, estab_id, historicos)
+            if forn and not estado["fornecedor_id"]:
+                estado["fornecedor_id"] = forn.id
+
+        qtd_anterior = Decimal(str(estado["quantidade"] or 0))
+        estado["quantidade"] = qtd_anterior + qtd
+        movimentacoes.append(dict(
+            estabelecimento_id=estab_id, produto_id=estado["id"], funcionario_id=funcionario_id,
             tipo="entrada", quantidade=qtd, quantidade_anterior=qtd_anterior,
-            quantidade_atual=prod.quantidade, custo_unitario=custo_unit,
+            quantidade_atual=estado["quantidade"], custo_unitario=custo_unit,
             valor_total=custo_unit * qtd,
             motivo=f"Entrada NF-e {parsed['numero']}/{parsed['serie']}",
             observacoes=f"Importação XML chave {chave}",
         ))
+    produtos_criados = len(novos)
+    produtos_atualizados = len(itens) - len(criados_em)
+
+    # 3) Resultado nos objetos já carregados: o flush do ORM agrupa as instruções e
+    #    passa pelos listeners (auditoria forense, fila de sincronização offline)
+    for estado in {e["id"]: e for e in estados}.values():
+        prod = estado["produto"]
+        prod.quantidade, prod.preco_custo, prod.margem_lucro, prod.fornecedor_id = (
+            estado["quantidade"], estado["preco_custo"], estado["margem_lucro"], estado["fornecedor_id"])
+    db.session.add_all([MovimentacaoEstoque(**m) for m in movimentacoes])
+    db.session.add_all([HistoricoPrecos(**h) for h in historicos])
 
     # Contas a pagar (duplicatas ou total único)
     data_emissao = _parse_data(parsed.get("data_emissao"))
@@ -258,3 +354,99 @@ def importar(parsed: Dict[str, Any], xml_text: str, estab_id: int, funcionario_i
         "fornecedor_id": forn.id if forn else None,
         "valor_total": float(parsed["total"]),
     }
+
+
+def _ler_zip(zip_bytes: bytes) -> List[Tuple[str, bytes]]:
+    """Extrai os .xml de um ZIP (subpastas incluídas), com limites contra arquivo-bomba."""
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(zip_bytes))
+    except zipfile.BadZipFile as e:
+        raise ImportacaoError(f"ZIP inválido: {e}") from e
+    with zf:
+        infos = [i for i in zf.infolist() if not i.is_dir() and i.filename.lower().endswith(".xml")]
+        if not infos:
+            raise ImportacaoError("O ZIP não contém arquivos .xml.")
+        if len(infos) > LOTE_MAX_ARQUIVOS:
+            raise ImportacaoError(f"O ZIP tem {len(infos)} XMLs; o máximo por envio é {LOTE_MAX_ARQUIVOS}.")
+        arquivos = []
+        for info in infos:
+            if info.file_size > LOTE_MAX_XML_BYTES:
+                raise ImportacaoError(f"{info.filename}: arquivo grande demais para uma NF-e.")
+            arquivos.append((info.filename, zf.read(info)))
+        return arquivos
+
+
+def _parse_arquivo(arquivo: Tuple[str, bytes]) -> Tuple[str, bytes, Optional[Dict[str, Any]], Optional[str]]:
+    nome, conteudo = arquivo
+    try:
+        return nome, conteudo, parse_nfe_xml(conteudo), None
+    except XMLNotaError as e:
+        return nome, conteudo, None, str(e)
+
+
+def importar_lote(zip_bytes: bytes, estab_id: int, funcionario_id: int,
+                  markup_padrao: Decimal = Decimal("30")) -> Dict[str, Any]:
+    """
+    Importa todas as NF-e de um ZIP.
+
+    A leitura dos XMLs roda em paralelo; a gravação é nota a nota (um commit por
+    nota, em ordem de emissão para o CMP seguir a cronologia), de modo que um
+    arquivo com problema não desfaz os demais. Idempotente pela chave de acesso:
+    notas já importadas — ou repetidas dentro do próprio ZIP — são puladas.
+    """
+    arquivos = _ler_zip(zip_bytes)
+    with ThreadPoolExecutor(max_workers=max(1, min(_PARSE_WORKERS, len(arquivos)))) as executor:
+        lidos = list(executor.map(_parse_arquivo, arquivos))
+
+    erros = [{"arquivo": nome, "erro": erro} for nome, _, parsed, erro in lidos if parsed is None]
+    validos = [(nome, conteudo, parsed) for nome, conteudo, parsed, _ in lidos if parsed is not None]
+    chaves = {parsed["chave_acesso"] for _, _, parsed in validos}
+    ja_importadas = set(db.session.execute(
+        select(NotaFiscalEntrada.chave_acesso).where(
+            NotaFiscalEntrada.estabelecimento_id == estab_id, NotaFiscalEntrada.chave_acesso.in_(chaves))
+    ).scalars()) if chaves else set()
+
+    validos.sort(key=lambda v: (_parse_data(v[2].get("data_emissao")) or datetime.max).replace(tzinfo=None))
+    importadas: List[Dict[str, Any]] = []
+    duplicadas: List[Dict[str, Any]] = []
+    for nome, conteudo, parsed in validos:
+        chave = parsed["chave_acesso"]
+        if chave in ja_importadas:
+            duplicadas.append({"arquivo": nome, "chave_acesso": chave})
+            continue
+        try:
+            resultado = importar(parsed, conteudo.decode("utf-8", errors="replace"), estab_id,
+                                 funcionario_id, markup_padrao)
+        except IntegrityError as e:
+            db.session.rollback()
+            if db.session.execute(select(NotaFiscalEntrada.id).where(
+                    NotaFiscalEntrada.estabelecimento_id == estab_id,
+                    NotaFiscalEntrada.chave_acesso == chave)).first():
+                # Outra requisição importou a mesma chave no meio do caminho
+                duplicadas.append({"arquivo": nome, "chave_acesso": chave})
+            else:
+                logger.error(f"Importação em lote: falha em {nome}: {e}")
+                erros.append({"arquivo": nome, "erro": "Falha ao importar a nota"})
+            continue
+        except ImportacaoError as e:
+            db.session.rollback()
+            erros.append({"arquivo": nome, "erro": str(e)})
+            continue
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Importação em lote: falha em {nome}: {e}")
+            erros.append({"arquivo": nome, "erro": "Falha ao importar a nota"})
+            continue
+        ja_importadas.add(chave)
+        importadas.append({"arquivo": nome, **resultado})
+
+    return {
+        "arquivos": len(arquivos),
+        "importadas": len(importadas),
+        "duplicadas": duplicadas,
+        "erros": erros,
+        "notas": importadas,
+        "produtos_criados": sum(r["produtos_criados"] for r in importadas),
+        "produtos_atualizados": sum(r["produtos_atualizados"] for r in importadas),
+        "valor_total": round(sum(r["valor_total"] for r in importadas), 2),
+    }
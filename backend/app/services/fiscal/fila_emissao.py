@@ -0,0 +1,240 @@
+"""
+Fila de emissão de NFC-e.
+
+O PDV não espera mais a SEFAZ: ao finalizar a venda, `FilaEmissaoNFCe.enfileirar`
+reserva o número, grava o DocumentoFiscal com status "fila" e devolve o cupom na
+hora. Um pool de workers (FilaEmissaoWorker) pega os documentos vencidos, envia
+ao gateway e reagenda com backoff exponencial em falha de comunicação ou quando
+o gateway responde "processando" (próxima tentativa vira consulta).
+
+A fila é a própria tabela documentos_fiscais (status + proxima_tentativa_em):
+sobrevive a restart e funciona com vários processos — cada worker reivindica o
+documento com um UPDATE condicional (lease) antes de processar.
+
+O caixa acompanha o resultado por long-poll em
+GET /api/fiscal/documentos/<id>/status?aguardar=N, acordado pelos workers
+assim que o status muda.
+
+Com o gateway fora do ar (disjuntor SaudeGateway aberto) a nota entra em
+contingência offline em vez de ficar em "erro"; documentos em contingência e
+consultas de documentos "processando" são tratados em lote por
+app.services.fiscal.contingencia, chamado pelo mesmo worker.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, or_, select
+
+from app.models import db, DocumentoFiscal, Estabelecimento, Venda, utcnow
+from app.services.fiscal import emissao_service
+from app.services.fiscal.gateways import SaudeGateway
+from app.services.fiscal.numeracao_service import NumeracaoFiscalService
+
+logger = logging.getLogger(__name__)
+
+_WORKERS = int(os.getenv("NFCE_FILA_WORKERS", "2"))
+_MAX_TENTATIVAS = int(os.getenv("NFCE_MAX_TENTATIVAS", "6"))
+_BACKOFF_BASE = float(os.getenv("NFCE_BACKOFF_BASE_SEC", "5"))
+_BACKOFF_MAX = 600.0
+_LEASE_SEC = int(os.getenv("NFCE_LEASE_SEC", "120"))  # documento reivindicado some da fila por este tempo
+_POLL_SEC = 5.0
+# Long-poll prende uma thread do servidor: poucos segundos bastam para o PDV, que repete a chamada
+_AGUARDAR_MAX_SEC = float(os.getenv("NFCE_AGUARDAR_MAX_SEC", "5"))
+_LOTE = 20
+
+STATUS_FINAIS = ("autorizado", "rejeitado", "erro", "cancelado")
+
+_acordar = threading.Event()
+_mudou = threading.Condition()
+_workers: List["FilaEmissaoWorker"] = []
+
+
+def backoff(tentativas: int) -> float:
+    """Espera antes da próxima tentativa: base·2^(n-1), limitada a 10 min."""
+    return min(_BACKOFF_MAX, _BACKOFF_BASE * (2 ** max(0, tentativas - 1)))
+
+
+def _notificar() -> None:
+    with _mudou:
+        _mudou.notify_all()
+
+
+class FilaEmissaoNFCe:
+
+    @staticmethod
+    def ativa() -> bool:
+        """Há workers rodando neste processo? Sem eles o PDV emite em linha (modo antigo)."""
+        return any(w.is_alive() for w in _workers)
+
+    @staticmethod
+    def enfileirar(venda: Venda, estab: Estabelecimento, funcionario_id: int) -> DocumentoFiscal:
+        """Reserva o número e põe a NFC-e na fila (sem chamada de rede). Commita.
+        Com o gateway fora do ar, a nota já sai em contingência."""
+        doc, preparado = emissao_service.preparar_nfce(venda, estab, funcionario_id, status_inicial="fila")
+        if preparado and not SaudeGateway.disponivel(SaudeGateway.chave(estab)):
+            emissao_service.entrar_contingencia(doc, estab, "Gateway fiscal indisponível: emitida em contingência.")
+        db.session.commit()
+        _acordar.set()
+        return doc
+
+    @staticmethod
+    def _reivindicar(doc_id: int) -> bool:
+        """UPDATE condicional: só um worker (de qualquer processo) leva o documento.
+        Já conta a tentativa e commita — nenhuma trava fica aberta durante a chamada ao gateway."""
+        agora = utcnow()
+        t = DocumentoFiscal.__table__
+        res = db.session.execute(
+            t.update()
+            .where(
+                t.c.id == doc_id, t.c.status.in_(("fila", "processando", "contingencia")),
+                or_(t.c.proxima_tentativa_em.is_(None), t.c.proxima_tentativa_em <= agora),
+            )
+            .values(proxima_tentativa_em=agora + timedelta(seconds=_LEASE_SEC), tentativas=t.c.tentativas + 1)
+        )
+        db.session.commit()
+        return res.rowcount == 1
+
+    @staticmethod
+    def processar(doc_id: int) -> Optional[str]:
+        """Um envio para um documento da fila já reivindicado."""
+        doc = db.session.get(DocumentoFiscal, doc_id)
+        if doc is None or doc.status != "fila":
+            return doc.status if doc else None
+        estab = db.session.get(Estabelecimento, doc.estabelecimento_id)
+        venda = db.session.get(Venda, doc.venda_id)
+
+        try:
+            resp = emissao_service.transmitir_nfce(doc, venda, estab)
+        except Exception as e:
+            # A nota pode ter chegado antes da queda: reaproveita o que o gateway já sabe dela
+            resp = emissao_service.consultar_apos_falha(doc, estab) or {
+                "status": "erro", "mensagem": f"Falha de comunicação com o gateway: {e}", "_rede": True}
+
+        status = resp.get("status")
+        if resp.get("_rede") and (doc.tentativas >= _MAX_TENTATIVAS
+                                  or not SaudeGateway.disponivel(SaudeGateway.chave(estab))):
+            # Gateway fora do ar: não segura a nota — contingência, transmitida depois em lote.
+            emissao_service.entrar_contingencia(doc, estab, resp["mensagem"])
+        elif status == "erro" and doc.tentativas < _MAX_TENTATIVAS:
+            # "erro" do contrato de gateways = falha de comunicação/HTTP (transitória);
+            # "rejeitado" é decisão da SEFAZ (definitiva).
+            doc.motivo_rejeicao = str(resp.get("mensagem"))
+            doc.proxima_tentativa_em = utcnow() + timedelta(seconds=backoff(doc.tentativas))
+        else:
+            if status == "erro":
+                # Última tentativa sem resposta útil: o número pode ter chegado à SEFAZ
+                resp = emissao_service.consultar_apos_falha(doc, estab) or resp
+            emissao_service.aplicar_resposta(doc, resp)
+            # "processando": a consulta em lote (contingencia.consultar_pendentes) acompanha
+            doc.proxima_tentativa_em = utcnow() + timedelta(seconds=_BACKOFF_BASE) if doc.status == "processando" else None
+        db.session.commit()
+        _notificar()
+        return doc.status
+
+    @staticmethod
+    def processar_pendentes(limite: int = _LOTE) -> Dict[int, str]:
+        """Processa os documentos vencidos da fila. Retorna {doc_id: status}."""
+        t = DocumentoFiscal.__table__
+        ids = db.session.execute(
+            select(t.c.id)
+            .where(
+                t.c.status == "fila",
+                or_(t.c.proxima_tentativa_em.is_(None), t.c.proxima_tentativa_em <= utcnow()),
+            )
+            .order_by(t.c.proxima_tentativa_em, t.c.id)
+            .limit(limite)
+        ).scalars().all()
+
+        resultado = {}
+        for doc_id in ids:
+            if not FilaEmissaoNFCe._reivindicar(doc_id):
+                continue  # outro worker levou
+            try:
+                resultado[doc_id] = FilaEmissaoNFCe.processar(doc_id)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"[FILA NFC-e] Documento {doc_id}: {e}")
+        return resultado
+
+    @staticmethod
+    def aguardar_status(doc_id: int, estab_id: int, timeout: float = 0) -> Optional[DocumentoFiscal]:
+        """Long-poll: devolve o documento assim que sair da fila (ou ao fim do timeout).
+
+        Acorda pelos workers deste processo e reconfere o banco a cada segundo
+        (workers em outro processo)."""
+        limite = time.monotonic() + max(0.0, min(float(timeout or 0), _AGUARDAR_MAX_SEC))
+        while True:
+            doc = DocumentoFiscal.query.filter_by(id=doc_id, estabelecimento_id=estab_id).first()
+            if doc is None or doc.status in STATUS_FINAIS:
+                return doc
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return doc
+            db.session.rollback()  # encerra a transação de leitura antes de esperar
+            with _mudou:
+                _mudou.wait(timeout=min(1.0, restante))
+
+    @staticmethod
+    def resumo(estab_id: int) -> Dict:
+        """Situação da fila e lacunas de numeração do estabelecimento."""
+        t = DocumentoFiscal.__table__
+        por_status = dict(db.session.execute(
+            select(t.c.status, func.count(t.c.id))
+            .where(t.c.estabelecimento_id == estab_id,
+                   t.c.status.in_(("fila", "contingencia", "processando", "erro", "rejeitado")))
+            .group_by(t.c.status)
+        ).all())
+        from app.services.fiscal.contingencia import ContingenciaService
+
+        resumo = {
+            "fila": por_status.get("fila", 0),
+            "contingencia": por_status.get("contingencia", 0),
+            "processando": por_status.get("processando", 0),
+            "erro": por_status.get("erro", 0),
+            "rejeitado": por_status.get("rejeitado", 0),
+            "lacunas": [l.to_dict() for l in NumeracaoFiscalService.lacunas(estab_id)],
+        }
+        resumo.update(ContingenciaService.metricas(estab_id, resumo))
+        return resumo
+
+
+class FilaEmissaoWorker(threading.Thread):
+    def __init__(self, app, indice: int):
+        super().__init__(name=f"nfce-fila-{indice}")
+        self.app = app
+        self.daemon = True
+
+    def run(self):
+        while True:
+            _acordar.wait(timeout=_POLL_SEC)
+            _acordar.clear()
+            try:
+                from app.services.fiscal.contingencia import ContingenciaService
+
+                with self.app.app_context():
+                    while FilaEmissaoNFCe.processar_pendentes():
+                        pass
+                    ContingenciaService.consultar_pendentes()
+                    ContingenciaService.transmitir()
+            except Exception as e:
+                self.app.logger.error(f"[FILA NFC-e] Erro no ciclo: {e}")
+
+
+def start_fila_emissao(app):
+    """Inicia o pool de workers da fila de NFC-e. Retorna a lista de threads (vazia se desabilitado)."""
+    if app.config.get("TESTING") or _WORKERS <= 0:
+        app.logger.info("[FILA NFC-e] Workers NÃO iniciados (desabilitado); PDV emite em linha.")
+        return []
+    if not _workers:
+        for i in range(_WORKERS):
+            worker = FilaEmissaoWorker(app, i)
+            worker.start()
+            _workers.append(worker)
+        app.logger.info(f"[FILA NFC-e] {_WORKERS} worker(s) iniciado(s).")
+    return list(_workers)
@@ -13,13 +13,33 @@ reescrever a regra de negócio. Implementações:
 Contrato (todas retornam dict):
     {status, chave, protocolo, numero, serie, danfe_url, xml_url, xml, qr_code, mensagem}
 status ∈ {autorizado, rejeitado, processando, erro}
+
+consultar_lote(referencias) devolve {referencia: resposta} — consultas em lote
+para a fila/contingência (uma rodada por estabelecimento, não uma por nota).
+
+SaudeGateway é um disjuntor por gateway/ambiente: após falhas de comunicação
+seguidas, o gateway é dado como fora do ar por um tempo e a emissão entra em
+contingência offline (ver app.services.fiscal.contingencia).
 """
 from __future__ import annotations
 
+import os
 import random
+import threading
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Optional
+
+
+# Código IBGE da UF (2 primeiros dígitos da chave de acesso)
+UF_IBGE = {
+    "RO": "11", "AC": "12", "AM": "13", "RR": "14", "PA": "15", "AP": "16", "TO": "17",
+    "MA": "21", "PI": "22", "CE": "23", "RN": "24", "PB": "25", "PE": "26", "AL": "27", "SE": "28", "BA": "29",
+    "MG": "31", "ES": "32", "RJ": "33", "SP": "35", "PR": "41", "SC": "42", "RS": "43",
+    "MS": "50", "MT": "51", "GO": "52", "DF": "53",
+}
 
 
 def _dv_chave(chave43: str) -> str:
@@ -58,6 +78,17 @@ class FiscalGateway(ABC):
     def cancelar(self, referencia: str, justificativa: str) -> Dict[str, Any]:
         ...
 
+    def consultar_lote(self, referencias: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Consulta várias referências. Padrão: sequencial; adapters com API em lote
+        ou conexão reaproveitável sobrescrevem."""
+        resultado = {}
+        for ref in referencias:
+            try:
+                resultado[ref] = self.consultar(ref)
+            except Exception as e:
+                resultado[ref] = {"status": "erro", "mensagem": f"Falha de comunicação com o gateway: {e}"}
+        return resultado
+
 
 class SimuladoGateway(FiscalGateway):
     """Emissão simulada — NÃO tem valor fiscal. Para desenvolvimento e testes."""
@@ -72,7 +103,7 @@ class SimuladoGateway(FiscalGateway):
         emit = payload.get("_emitente", {})
         uf = (emit.get("uf") or "SP").upper()
         uf_cod = self.UF_COD.get(uf, "35")
-        chave = gerar_chave_acesso(
+        chave = payload.get("chave_nfe") or gerar_chave_acesso(
             uf_cod, emit.get("cnpj", "0"), payload.get("modelo", "65"),
             int(payload.get("serie", 1)), int(payload.get("numero", 1)),
         )
@@ -92,6 +123,9 @@ class SimuladoGateway(FiscalGateway):
     def consultar(self, referencia: str) -> Dict[str, Any]:
         return {"status": "autorizado", "mensagem": "Consulta simulada."}
 
+    def consultar_lote(self, referencias: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        return {ref: self.consultar(ref) for ref in referencias}
+
     def cancelar(self, referencia: str, justificativa: str) -> Dict[str, Any]:
         return {"status": "cancelado", "mensagem": "Cancelamento simulado."}
 
@@ -104,14 +138,23 @@ class FocusNFeGateway(FiscalGateway):
         "producao": "https://api.focusnfe.com.br",
     }
 
+    CONCORRENCIA_CONSULTA = int(os.getenv("NFCE_CONSULTA_CONCORRENCIA", "8"))
+
     def __init__(self, token: str, ambiente: str = "homologacao"):
         self.token = token
         self.base = self.BASE.get(ambiente, self.BASE["homologacao"])
 
+    def _sessao(self):
+        # Conexão HTTP reaproveitada (keep-alive) entre envios/consultas do mesmo lote
+        if getattr(self, "_http", None) is None:
+            import requests
+            self._http = requests.Session()
+            self._http.auth = (self.token, "")
+        return self._http
+
     def _request(self, method: str, path: str, json_body: Optional[dict] = None) -> Dict[str, Any]:
-        import requests
         url = f"{self.base}{path}"
-        resp = requests.request(method, url, json=json_body, auth=(self.token, ""), timeout=30)
+        resp = self._sessao().request(method, url, json=json_body, timeout=30)
         try:
             data = resp.json()
         except Exception:
@@ -146,6 +189,16 @@ class FocusNFeGateway(FiscalGateway):
     def consultar(self, referencia: str) -> Dict[str, Any]:
         return self._normalizar(self._request("GET", f"/v2/nfce/{referencia}"))
 
+    def consultar_lote(self, referencias: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        # A Focus não tem consulta em lote de NFC-e: consultas paralelas limitadas,
+        # reaproveitando a mesma sessão HTTP.
+        refs = list(referencias)
+        if len(refs) <= 1:
+            return super().consultar_lote(refs)
+        with ThreadPoolExecutor(max_workers=min(self.CONCORRENCIA_CONSULTA, len(refs))) as executor:
+            respostas = list(executor.map(lambda r: super(FocusNFeGateway, self).consultar_lote([r])[r], refs))
+        return dict(zip(refs, respostas))
+
     def cancelar(self, referencia: str, justificativa: str) -> Dict[str, Any]:
         return self._normalizar(self._request(
             "DELETE", f"/v2/nfce/{referencia}", {"justificativa": justificativa}))
@@ -160,3 +213,62 @@ def get_gateway(estabelecimento) -> FiscalGateway:
         return FocusNFeGateway(token=token, ambiente=ambiente)
     # Default seguro: simulado (não emite nada com valor fiscal)
     return SimuladoGateway(estabelecimento=estabelecimento)
+
+
+class SaudeGateway:
+    """Disjuntor em memória por gateway/ambiente.
+
+    fechado → (N falhas de comunicação seguidas) → aberto por PAUSA segundos →
+    meio-aberto (deixa uma tentativa passar: sucesso fecha, falha reabre)."""
+
+    FALHAS_PARA_ABRIR = int(os.getenv("NFCE_CIRCUITO_FALHAS", "3"))
+    PAUSA_SEC = float(os.getenv("NFCE_CIRCUITO_PAUSA_SEC", "60"))
+
+    _lock = threading.Lock()
+    _estado: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def chave(estabelecimento) -> str:
+        nome = (getattr(estabelecimento, "fiscal_gateway", None) or "simulado").lower()
+        ambiente = getattr(estabelecimento, "fiscal_ambiente", None) or "homologacao"
+        return f"{nome}:{ambiente}"
+
+    @classmethod
+    def disponivel(cls, chave: str) -> bool:
+        with cls._lock:
+            st = cls._estado.get(chave)
+            if not st or st["aberto_ate"] == 0:
+                return True
+            return time.monotonic() >= st["aberto_ate"]  # meio-aberto após a pausa
+
+    @classmethod
+    def registrar_sucesso(cls, chave: str) -> None:
+        with cls._lock:
+            cls._estado.pop(chave, None)
+
+    @classmethod
+    def registrar_falha(cls, chave: str) -> bool:
+        """Conta a falha; retorna True se o disjuntor (re)abriu."""
+        with cls._lock:
+            st = cls._estado.setdefault(chave, {"falhas": 0, "aberto_ate": 0})
+            st["falhas"] += 1
+            meio_aberto = st["aberto_ate"] and time.monotonic() >= st["aberto_ate"]
+            if st["falhas"] >= cls.FALHAS_PARA_ABRIR or meio_aberto:
+                st["aberto_ate"] = time.monotonic() + cls.PAUSA_SEC
+                return True
+            return False
+
+    @classmethod
+    def situacao(cls) -> Dict[str, Dict[str, Any]]:
+        agora = time.monotonic()
+        with cls._lock:
+            return {
+                k: {"falhas": int(v["falhas"]), "aberto": bool(v["aberto_ate"] and agora < v["aberto_ate"]),
+                    "reabre_em_seg": max(0, round(v["aberto_ate"] - agora, 1)) if v["aberto_ate"] else 0}
+                for k, v in cls._estado.items()
+            }
+
+    @classmethod
+    def resetar(cls) -> None:
+        with cls._lock:
+            cls._estado.clear()
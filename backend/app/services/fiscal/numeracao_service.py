@@ -0,0 +1,110 @@
+"""
+Numeração fiscal por (estabelecimento, modelo, série).
+
+Antes, a emissão lia estab.proximo_numero_nfce sem trava e só avançava após a
+autorização: dois caixas emitindo ao mesmo tempo pegavam o mesmo número. Agora
+o número é reservado por um UPDATE atômico na linha da série (numeracao_fiscal)
+e nunca é reaproveitado por outro documento. Número reservado que não vira nota
+autorizada fica registrado como lacuna (numeracao_fiscal_lacunas) para ser
+inutilizado na SEFAZ.
+"""
+from __future__ import annotations
+
+import logging
+from typing import List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Estabelecimento, NumeracaoFiscal, NumeracaoFiscalLacuna, utcnow
+
+logger = logging.getLogger(__name__)
+
+
+class NumeracaoFiscalService:
+
+    @staticmethod
+    def _incrementar(conn, estab_id: int, modelo: str, serie: int) -> Optional[int]:
+        t = NumeracaoFiscal.__table__
+        row = conn.execute(
+            t.update()
+            .where(t.c.estabelecimento_id == estab_id, t.c.modelo == modelo, t.c.serie == serie)
+            .values(proximo_numero=t.c.proximo_numero + 1, atualizado_em=utcnow())
+            .returning(t.c.proximo_numero)
+        ).first()
+        return int(row[0]) - 1 if row else None
+
+    @staticmethod
+    def reservar(estab: Estabelecimento, modelo: str = "65", serie: Optional[int] = None) -> int:
+        """
+        Reserva o próximo número da série (atômico; a linha fica travada só até o
+        commit da transação corrente — quem chama deve commitar logo em seguida).
+
+        Na primeira reserva a sequência é semeada a partir de
+        estab.proximo_numero_nfce (numeração usada antes desta tabela existir).
+        """
+        serie = int(serie if serie is not None else (getattr(estab, "serie_nfce", 1) or 1))
+        conn = db.session.connection()
+        numero = NumeracaoFiscalService._incrementar(conn, estab.id, modelo, serie)
+        if numero is None:
+            inicial = int(getattr(estab, "proximo_numero_nfce", 1) or 1)
+            try:
+                with db.session.begin_nested():
+                    db.session.connection().execute(NumeracaoFiscal.__table__.insert().values(
+                        estabelecimento_id=estab.id, modelo=modelo, serie=serie,
+                        proximo_numero=inicial + 1, atualizado_em=utcnow(),
+                    ))
+                numero = inicial
+            except IntegrityError:
+                # Outro caixa semeou a série ao mesmo tempo: só incrementar.
+                numero = NumeracaoFiscalService._incrementar(db.session.connection(), estab.id, modelo, serie)
+
+        # Espelho em estabelecimentos (tela de configuração / legado), só avança.
+        if modelo == "65" and serie == int(getattr(estab, "serie_nfce", 1) or 1):
+            e = Estabelecimento.__table__
+            db.session.connection().execute(
+                e.update()
+                .where(e.c.id == estab.id, func.coalesce(e.c.proximo_numero_nfce, 0) < numero + 1)
+                .values(proximo_numero_nfce=numero + 1)
+            )
+            db.session.expire(estab, ["proximo_numero_nfce"])
+        return numero
+
+    @staticmethod
+    def registrar_lacuna(doc, motivo: str) -> None:
+        """Marca o número do documento como lacuna (idempotente)."""
+        if not doc.numero:
+            return
+        t = NumeracaoFiscalLacuna.__table__
+        chave = dict(estabelecimento_id=doc.estabelecimento_id, modelo=doc.modelo or "65",
+                     serie=int(doc.serie or 1), numero=int(doc.numero))
+        existe = db.session.execute(
+            select(t.c.id).where(*[t.c[k] == v for k, v in chave.items()])
+        ).first()
+        if existe:
+            return
+        db.session.execute(t.insert().values(
+            documento_id=doc.id, motivo=(motivo or "")[:1000], criado_em=utcnow(), **chave
+        ))
+        logger.warning(f"Lacuna de numeração: estab {doc.estabelecimento_id} série {chave['serie']} nº {chave['numero']}")
+
+    @staticmethod
+    def resolver_lacuna(doc) -> None:
+        """O número foi autorizado (reemissão): deixa de ser lacuna."""
+        if not doc.numero:
+            return
+        t = NumeracaoFiscalLacuna.__table__
+        db.session.execute(t.delete().where(
+            t.c.estabelecimento_id == doc.estabelecimento_id, t.c.modelo == (doc.modelo or "65"),
+            t.c.serie == int(doc.serie or 1), t.c.numero == int(doc.numero),
+            t.c.inutilizada_em.is_(None),
+        ))
+
+    @staticmethod
+    def lacunas(estab_id: int, serie: Optional[int] = None, pendentes: bool = True) -> List[NumeracaoFiscalLacuna]:
+        q = NumeracaoFiscalLacuna.query.filter_by(estabelecimento_id=estab_id)
+        if serie is not None:
+            q = q.filter_by(serie=int(serie))
+        if pendentes:
+            q = q.filter(NumeracaoFiscalLacuna.inutilizada_em.is_(None))
+        return q.order_by(NumeracaoFiscalLacuna.serie, NumeracaoFiscalLacuna.numero).all()
@@ -10,6 +10,7 @@ autorizado pelo fornecedor.
 """
 from __future__ import annotations
 
+import io
 import re
 import xml.etree.ElementTree as ET
 from decimal import Decimal, InvalidOperation
@@ -25,13 +26,6 @@ def _strip_ns(tag: str) -> str:
     return tag.split("}", 1)[-1] if "}" in tag else tag
 
 
-def _localname_tree(root: ET.Element) -> ET.Element:
-    """Reescreve as tags do elemento (e filhos) sem namespace, para navegação simples."""
-    for el in root.iter():
-        el.tag = _strip_ns(el.tag)
-    return root
-
-
 def _find(el: Optional[ET.Element], path: str) -> Optional[ET.Element]:
     return el.find(path) if el is not None else None
 
@@ -56,6 +50,27 @@ def _only_digits(value: Optional[str]) -> str:
     return re.sub(r"\D", "", value or "")
 
 
+def _item(det: ET.Element) -> Optional[Dict[str, Any]]:
+    prod = det.find("prod")
+    if prod is None:
+        return None
+    ean = _text(prod, "cEAN") or ""
+    if ean.upper() in ("SEM GTIN", "SEMGTIN"):
+        ean = ""
+    return {
+        "codigo": _text(prod, "cProd"),
+        "ean": _only_digits(ean) or None,
+        "descricao": _text(prod, "xProd"),
+        "ncm": _text(prod, "NCM"),
+        "cest": _text(prod, "CEST"),
+        "cfop": _text(prod, "CFOP"),
+        "unidade": _text(prod, "uCom"),
+        "quantidade": _dec(_text(prod, "qCom")),
+        "valor_unitario": _dec(_text(prod, "vUnCom")),
+        "valor_total": _dec(_text(prod, "vProd")),
+    }
+
+
 def parse_nfe_xml(xml_bytes: bytes | str) -> Dict[str, Any]:
     """
     Faz o parsing de um XML de NF-e (modelo 55) e retorna um dicionário normalizado.
@@ -79,13 +94,27 @@ def parse_nfe_xml(xml_bytes: bytes | str) -> Dict[str, Any]:
     """
     if isinstance(xml_bytes, str):
         xml_bytes = xml_bytes.encode("utf-8")
+
+    # Leitura em fluxo (iterparse): o namespace sai de cada tag quando o elemento
+    # fecha, e cada <det> vira item e é descartado na hora — notas com centenas de
+    # itens não mantêm a árvore inteira dos produtos em memória.
+    root: Optional[ET.Element] = None
+    itens: List[Dict[str, Any]] = []
     try:
-        root = ET.fromstring(xml_bytes)
+        for evento, el in ET.iterparse(io.BytesIO(xml_bytes), events=("start", "end")):
+            if evento == "start":
+                if root is None:
+                    root = el
+                continue
+            el.tag = _strip_ns(el.tag)
+            if el.tag == "det":
+                item = _item(el)
+                if item:
+                    itens.append(item)
+                el.clear()
     except ET.ParseError as e:
         raise XMLNotaError(f"XML inválido: {e}") from e
 
-    _localname_tree(root)
-
     # Aceita tanto <nfeProc> quanto <NFe> na raiz
     nfe = root if root.tag == "NFe" else root.find("NFe")
     if nfe is None:
@@ -126,27 +155,6 @@ def parse_nfe_xml(xml_bytes: bytes | str) -> Dict[str, Any]:
         "nome": _text(dest, "xNome"),
     }
 
-    itens: List[Dict[str, Any]] = []
-    for det in inf.findall("det"):
-        prod = det.find("prod")
-        if prod is None:
-            continue
-        ean = _text(prod, "cEAN") or ""
-        if ean.upper() in ("SEM GTIN", "SEMGTIN"):
-            ean = ""
-        itens.append({
-            "codigo": _text(prod, "cProd"),
-            "ean": _only_digits(ean) or None,
-            "descricao": _text(prod, "xProd"),
-            "ncm": _text(prod, "NCM"),
-            "cest": _text(prod, "CEST"),
-            "cfop": _text(prod, "CFOP"),
-            "unidade": _text(prod, "uCom"),
-            "quantidade": _dec(_text(prod, "qCom")),
-            "valor_unitario": _dec(_text(prod, "vUnCom")),
-            "valor_total": _dec(_text(prod, "vProd")),
-        })
-
     if not itens:
         raise XMLNotaError("NF-e sem itens (<det>/<prod>).")
 
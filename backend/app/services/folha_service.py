@@ -0,0 +1,214 @@
+"""
+Processamento da folha em lote (tabelas folha_processamentos / itens).
+
+Fechar o mês chamando /holerite, /provisoes e /retrospectiva funcionário a
+funcionário recalculava ponto e benefícios a cada requisição. Aqui a loja
+inteira é processada de uma vez para a competência ('YYYY-MM'):
+
+- ponto: um GROUP BY funcionario_id no consolidado diário (PontoDiario);
+- benefícios ativos: uma consulta para todos os funcionários;
+- ConfiguracaoFolha, jornada e regime tributário: lidos uma vez;
+- vendas e entradas de estoque do mês: um GROUP BY cada (entram na assinatura
+  da retrospectiva).
+
+O resultado vira um snapshot imutável (FolhaProcessamento + uma linha por
+funcionário) e as leituras do mês passam a servir dele. Cada linha guarda a
+assinatura (SHA-256) das entradas usadas; reprocessar o mês gera a versão
+seguinte recalculando só quem teve a assinatura alterada (batida nova, troca
+de salário, benefício...) e copiando as demais linhas da versão anterior. Se
+nada mudou, a versão vigente é devolvida sem gravar outra.
+
+Entregas (vínculo motorista por CPF) entram na retrospectiva mas não na
+assinatura; use ``forcar`` para recalcular quem só teve entregas novas.
+"""
+import hashlib
+import json
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import func
+
+from app.models import (
+    db, Beneficio, Estabelecimento, FolhaProcessamento, FolhaProcessamentoItem, Funcionario,
+    FuncionarioBeneficio, MovimentacaoEstoque, Venda,
+)
+from app.services.ponto_diario_service import PontoDiarioService
+from app.services.rh_calculator_service import (
+    calcular_holerite, calcular_provisoes, calcular_retrospectiva, limites_do_mes, obter_config_folha,
+    resumo_ponto_consolidado,
+)
+from app.utils.query_helpers import filtro_periodo
+
+logger = logging.getLogger(__name__)
+
+_TIPOS_ENTRADA_ESTOQUE = ["entrada", "ENTRADA", "compra", "recebimento"]
+
+
+def _assinatura(entradas: dict) -> str:
+    return hashlib.sha256(json.dumps(entradas, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class FolhaService:
+    @staticmethod
+    def ultimo(estabelecimento_id, mes_referencia):
+        """Versão vigente (mais recente) do processamento do mês, ou None."""
+        return (FolhaProcessamento.query
+                .filter_by(estabelecimento_id=estabelecimento_id, mes_referencia=mes_referencia)
+                .order_by(FolhaProcessamento.versao.desc())
+                .first())
+
+    @staticmethod
+    def item(estabelecimento_id, mes_referencia, funcionario_id):
+        """Linha do funcionário na versão vigente do mês, ou None (mês não processado)."""
+        processamento = FolhaService.ultimo(estabelecimento_id, mes_referencia)
+        if processamento is None:
+            return None
+        return (FolhaProcessamentoItem.query
+                .filter_by(processamento_id=processamento.id, funcionario_id=funcionario_id)
+                .first())
+
+    @staticmethod
+    def itens(processamento):
+        return (FolhaProcessamentoItem.query
+                .filter_by(processamento_id=processamento.id)
+                .order_by(FolhaProcessamentoItem.funcionario_id)
+                .all())
+
+    # ------------------------------------------------------------------
+    # Entradas agregadas (uma consulta por fonte, para a loja inteira)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _beneficios(estabelecimento_id):
+        linhas = (db.session.query(FuncionarioBeneficio.funcionario_id, Beneficio.nome, FuncionarioBeneficio.valor)
+                  .join(Beneficio, FuncionarioBeneficio.beneficio_id == Beneficio.id)
+                  .filter(FuncionarioBeneficio.estabelecimento_id == estabelecimento_id,
+                          FuncionarioBeneficio.ativo == True)
+                  .order_by(FuncionarioBeneficio.id))
+        por_funcionario = defaultdict(list)
+        for funcionario_id, nome, valor in linhas:
+            por_funcionario[funcionario_id].append((nome or "Benefício", valor))
+        return por_funcionario
+
+    @staticmethod
+    def _atividade(estabelecimento_id, inicio, fim):
+        """{funcionario_id: (vendas, faturamento, entradas de estoque)} do período."""
+        atividade = defaultdict(lambda: [0, 0, 0])
+        vendas = (db.session.query(Venda.funcionario_id, func.count(Venda.id), func.coalesce(func.sum(Venda.total), 0))
+                  .filter(Venda.estabelecimento_id == estabelecimento_id, Venda.status == "finalizada",
+                          filtro_periodo(Venda.data_venda, inicio, fim))
+                  .group_by(Venda.funcionario_id))
+        for funcionario_id, quantidade, total in vendas:
+            atividade[funcionario_id][0:2] = [int(quantidade), str(Decimal(str(total or 0)).quantize(Decimal("0.01")))]
+        entradas = (db.session.query(MovimentacaoEstoque.funcionario_id, func.count(MovimentacaoEstoque.id))
+                    .filter(MovimentacaoEstoque.estabelecimento_id == estabelecimento_id,
+                            MovimentacaoEstoque.funcionario_id.isnot(None),
+                            MovimentacaoEstoque.tipo.in_(_TIPOS_ENTRADA_ESTOQUE),
+                            filtro_periodo(MovimentacaoEstoque.created_at, inicio, fim))
+                    .group_by(MovimentacaoEstoque.funcionario_id))
+        for funcionario_id, quantidade in entradas:
+            atividade[funcionario_id][2] = int(quantidade)
+        return atividade
+
+    @staticmethod
+    def _parametros(config_folha, jornada, regime):
+        return {
+            "jornada": jornada,
+            "regime": regime,
+            "divisor_horas_mensais": config_folha.divisor_horas_mensais,
+            "percentual_hora_extra": config_folha.percentual_hora_extra,
+            "fgts_percentual": config_folha.fgts_percentual,
+            "desconto_vt_percentual": config_folha.desconto_vt_percentual,
+            "inss_faixas": config_folha.inss_faixas,
+            "irrf_faixas": config_folha.irrf_faixas,
+        }
+
+    # ------------------------------------------------------------------
+    # Processamento
+    # ------------------------------------------------------------------
+    @staticmethod
+    def processar(estabelecimento_id, mes_referencia, forcar=False, criado_por_id=None) -> FolhaProcessamento:
+        """
+        Processa a folha do mês para os funcionários ativos da loja e grava uma
+        nova versão (commit incluso) — ou devolve a vigente se nenhuma entrada
+        mudou. ``forcar``: True recalcula todos; um iterável de ids recalcula
+        esses mesmo sem mudança de assinatura.
+        """
+        inicio, fim = limites_do_mes(mes_referencia)
+        forcados = set() if forcar in (False, None) else (None if forcar is True else {int(i) for i in forcar})
+
+        funcionarios = (Funcionario.query
+                        .filter(Funcionario.estabelecimento_id == estabelecimento_id, Funcionario.ativo == True)
+                        .order_by(Funcionario.id)
+                        .all())
+        config_folha = obter_config_folha(estabelecimento_id)
+        jornada = PontoDiarioService.jornada(estabelecimento_id)
+        estab = db.session.get(Estabelecimento, estabelecimento_id)
+        regime = getattr(estab, "regime_tributario", None)
+        parametros = FolhaService._parametros(config_folha, jornada, regime)
+
+        ponto = PontoDiarioService.resumo_por_funcionario(estabelecimento_id, inicio, fim)
+        beneficios = FolhaService._beneficios(estabelecimento_id)
+        atividade = FolhaService._atividade(estabelecimento_id, inicio, fim)
+
+        anterior = FolhaService.ultimo(estabelecimento_id, mes_referencia)
+        linhas_anteriores = ({i.funcionario_id: i for i in FolhaService.itens(anterior)} if anterior else {})
+
+        itens, recalculados = [], 0
+        for f in funcionarios:
+            resumo_ponto = resumo_ponto_consolidado(ponto.get(f.id), jornada)
+            beneficios_f = beneficios.get(f.id, [])
+            assinatura = _assinatura({
+                "parametros": parametros,
+                "funcionario": [f.nome, f.cargo, f.cpf, f.salario_base, f.data_admissao],
+                "ponto": resumo_ponto,
+                "beneficios": beneficios_f,
+                "atividade": atividade.get(f.id),
+            })
+            linha = linhas_anteriores.get(f.id)
+            reaproveita = (linha is not None and linha.assinatura == assinatura
+                           and forcados is not None and f.id not in forcados)
+            if reaproveita:
+                itens.append(FolhaProcessamentoItem(
+                    estabelecimento_id=estabelecimento_id, funcionario_id=f.id, assinatura=assinatura,
+                    recalculado=False, liquido=linha.liquido, custo_real=linha.custo_real,
+                    holerite_json=linha.holerite_json, provisoes_json=linha.provisoes_json,
+                    retrospectiva_json=linha.retrospectiva_json,
+                ))
+                continue
+
+            holerite = calcular_holerite(f, mes_referencia, config_folha,
+                                         resumo_ponto=resumo_ponto, beneficios=beneficios_f)
+            provisoes = calcular_provisoes(f, mes_referencia, regime, config_folha)
+            total_beneficios = sum(Decimal(str(v or 0)) for _, v in beneficios_f)
+            provisoes["beneficios"] = round(float(total_beneficios), 2)
+            provisoes["custo_real"] = round(provisoes["custo_real"] + float(total_beneficios), 2)
+            retrospectiva = calcular_retrospectiva(f, inicio, fim, resumo_ponto=resumo_ponto)
+            itens.append(FolhaProcessamentoItem(
+                estabelecimento_id=estabelecimento_id, funcionario_id=f.id, assinatura=assinatura,
+                recalculado=True, liquido=holerite["totais"]["liquido"], custo_real=provisoes["custo_real"],
+                holerite_json=holerite, provisoes_json=provisoes, retrospectiva_json=retrospectiva,
+            ))
+            recalculados += 1
+
+        if anterior is not None and recalculados == 0 and set(linhas_anteriores) == {i.funcionario_id for i in itens}:
+            return anterior
+
+        processamento = FolhaProcessamento(
+            estabelecimento_id=estabelecimento_id, mes_referencia=mes_referencia,
+            versao=(anterior.versao + 1) if anterior else 1, criado_por_id=criado_por_id,
+            funcionarios=len(itens), recalculados=recalculados,
+            total_vencimentos=sum(Decimal(str(i.holerite_json["totais"]["vencimentos"])) for i in itens),
+            total_descontos=sum(Decimal(str(i.holerite_json["totais"]["descontos"])) for i in itens),
+            total_liquido=sum(Decimal(str(i.liquido or 0)) for i in itens),
+            total_custo_real=sum(Decimal(str(i.custo_real or 0)) for i in itens),
+        )
+        db.session.add(processamento)
+        db.session.flush()
+        for item in itens:
+            item.processamento_id = processamento.id
+        db.session.add_all(itens)
+        db.session.commit()
+        logger.info("Folha %s da loja %s processada (v%s): %s funcionários, %s recalculados",
+                    mes_referencia, estabelecimento_id, processamento.versao, len(itens), recalculados)
+        return processamento
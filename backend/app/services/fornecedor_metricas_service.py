@@ -0,0 +1,311 @@
+"""
+Snapshot analítico de fornecedores (tabela fornecedores_metricas).
+
+Uma linha por fornecedor com pedidos, volume comprado, última compra,
+classificação e contas a pagar em aberto, mais nome/CNPJ já normalizados
+(minúsculo, sem acento, só dígitos). Listagem, busca e estatísticas leem daqui:
+
+- antes, a listagem fazia duas consultas por fornecedor da página (último
+  pedido e produtos ativos) e a busca dobrava acentos com ~50 REPLACE aninhados
+  em cinco colunas — nada disso usa índice;
+- agora a busca é um LIKE sobre nome_busca/cnpj_digitos (índices por
+  estabelecimento) e as métricas já estão prontas.
+
+O snapshot é recalculado incrementalmente no after_flush (app.models) só para
+os fornecedores tocados por fornecedores, pedidos_compra ou contas_pagar, com
+agregações em lote (GROUP BY) — nunca por linha.
+"""
+import logging
+import re
+import threading
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, case, func, or_, select
+
+from app.models import db, ContaPagar, Fornecedor, FornecedorMetrica, PedidoCompra
+from app.utils.query_helpers import _strip_accents
+
+logger = logging.getLogger(__name__)
+
+STATUS_COMPRA_EFETIVADA = ("recebido", "concluido")
+STATUS_CONTA_QUITADA = ("pago", "cancelado")
+_LOTE_IDS = 500
+
+# Estabelecimentos cujo snapshot já foi conferido neste processo (bootstrap
+# preguiçoso após a migração ou após cargas feitas fora do ORM).
+_lock = threading.Lock()
+_verificados: set = set()
+
+
+def normalizar_busca(texto) -> str:
+    """Minúsculo, sem acento e com espaços colapsados (mesma regra do termo buscado)."""
+    return " ".join(_strip_accents(str(texto or "")).lower().split())
+
+
+def classificar(valor_comprado, total_pedidos: int) -> str:
+    """Mesmas faixas de routes.fornecedores.calcular_classificacao_fornecedor."""
+    if not total_pedidos:
+        return "NOVO"
+    valor = float(valor_comprado or 0)
+    if valor > 100000:
+        return "PREMIUM"
+    if valor > 50000:
+        return "A"
+    if valor > 10000:
+        return "B"
+    return "C"
+
+
+class FornecedorMetricasService:
+
+    @staticmethod
+    def recalcular(fornecedor_ids: Iterable[int], connection=None) -> int:
+        """
+        Recalcula o snapshot dos fornecedores informados (3 consultas agregadas por lote).
+
+        Args:
+            fornecedor_ids: fornecedores a recalcular.
+            connection: conexão da transação corrente (o listener de after_flush
+                passa session.connection() para gravar na mesma transação).
+
+        Returns:
+            Quantidade de linhas de snapshot gravadas.
+        """
+        conn = connection if connection is not None else db.session.connection()
+        ids = sorted({int(i) for i in fornecedor_ids if i is not None})
+        gravadas = 0
+        for inicio in range(0, len(ids), _LOTE_IDS):
+            gravadas += FornecedorMetricasService._recalcular_lote(conn, ids[inicio:inicio + _LOTE_IDS])
+        return gravadas
+
+    @staticmethod
+    def _recalcular_lote(conn, ids: List[int]) -> int:
+        f, p, c = Fornecedor.__table__, PedidoCompra.__table__, ContaPagar.__table__
+        snap = FornecedorMetrica.__table__
+
+        fornecedores = conn.execute(
+            select(f.c.id, f.c.estabelecimento_id, f.c.nome_fantasia, f.c.razao_social, f.c.contato_nome,
+                   f.c.email, f.c.cnpj, f.c.estado, f.c.ativo, f.c.data_cadastro)
+            .where(f.c.id.in_(ids), f.c.deleted_at.is_(None))
+        ).all()
+
+        efetivado = p.c.status.in_(STATUS_COMPRA_EFETIVADA)
+        pedidos = {
+            r.fornecedor_id: r for r in conn.execute(
+                select(
+                    p.c.fornecedor_id,
+                    func.count(p.c.id).label("total_pedidos"),
+                    func.sum(case((efetivado, 1), else_=0)).label("pedidos_recebidos"),
+                    func.coalesce(func.sum(case((efetivado, p.c.total), else_=0)), 0).label("valor_comprado"),
+                    func.max(p.c.data_pedido).label("ultima_compra"),
+                )
+                .where(p.c.fornecedor_id.in_(ids), or_(p.c.status.is_(None), p.c.status != "cancelado"))
+                .group_by(p.c.fornecedor_id)
+            )
+        }
+        contas = {
+            r.fornecedor_id: r for r in conn.execute(
+                select(
+                    c.c.fornecedor_id,
+                    func.count(c.c.id).label("contas_abertas"),
+                    func.coalesce(func.sum(c.c.valor_atual), 0).label("valor_em_aberto"),
+                )
+                .where(c.c.fornecedor_id.in_(ids), or_(c.c.status.is_(None), c.c.status.notin_(STATUS_CONTA_QUITADA)))
+                .group_by(c.c.fornecedor_id)
+            )
+        }
+
+        agora = datetime.utcnow()
+        linhas = []
+        for forn in fornecedores:
+            ped, cta = pedidos.get(forn.id), contas.get(forn.id)
+            total_pedidos = int(ped.total_pedidos) if ped else 0
+            valor = Decimal(str(ped.valor_comprado)) if ped else Decimal("0")
+            linhas.append({
+                "estabelecimento_id": forn.estabelecimento_id, "fornecedor_id": forn.id,
+                "nome_fantasia": forn.nome_fantasia,
+                "nome_busca": normalizar_busca(" | ".join(
+                    v for v in (forn.nome_fantasia, forn.razao_social, forn.contato_nome, forn.email) if v
+                ))[:500],
+                "cnpj_digitos": re.sub(r"\D", "", forn.cnpj or "")[:14],
+                "estado": forn.estado, "ativo": bool(forn.ativo) if forn.ativo is not None else True,
+                "data_cadastro": forn.data_cadastro,
+                "total_pedidos": total_pedidos,
+                "pedidos_recebidos": int(ped.pedidos_recebidos or 0) if ped else 0,
+                "valor_comprado": valor,
+                "ultima_compra": ped.ultima_compra if ped else None,
+                "contas_abertas": int(cta.contas_abertas) if cta else 0,
+                "valor_em_aberto": Decimal(str(cta.valor_em_aberto)) if cta else Decimal("0"),
+                "classificacao": classificar(valor, total_pedidos),
+                "atualizado_em": agora,
+            })
+
+        # Fornecedores excluídos (soft ou hard delete) simplesmente saem do snapshot.
+        vivos = [linha["fornecedor_id"] for linha in linhas]
+        conn.execute(snap.delete().where(snap.c.fornecedor_id.in_(ids), snap.c.fornecedor_id.notin_(vivos)))
+        if linhas:
+            FornecedorMetricasService._gravar(conn, linhas)
+        return len(linhas)
+
+    @staticmethod
+    def _gravar(conn, linhas: List[dict]) -> None:
+        """UPSERT por fornecedor_id: dois flushes concorrentes do mesmo fornecedor
+        não colidem na unicidade (o último a gravar vence)."""
+        snap = FornecedorMetrica.__table__
+        colunas = [k for k in linhas[0] if k != "fornecedor_id"]
+
+        dialeto = conn.dialect.name
+        if dialeto in ("postgresql", "sqlite"):
+            if dialeto == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as _insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as _insert
+            stmt = _insert(snap)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=["fornecedor_id"], set_={c: stmt.excluded[c] for c in colunas},
+            ), linhas)
+            return
+
+        existentes = set(conn.execute(
+            select(snap.c.fornecedor_id).where(snap.c.fornecedor_id.in_([l["fornecedor_id"] for l in linhas]))
+        ).scalars())
+        atualizar = [l for l in linhas if l["fornecedor_id"] in existentes]
+        if atualizar:
+            conn.execute(
+                snap.update().where(snap.c.fornecedor_id == bindparam("b_fornecedor_id"))
+                .values({c: bindparam(f"b_{c}") for c in colunas}),
+                [{f"b_{k}": v for k, v in l.items()} for l in atualizar],
+            )
+        novas = [l for l in linhas if l["fornecedor_id"] not in existentes]
+        if novas:
+            conn.execute(snap.insert(), novas)
+
+    @staticmethod
+    def recalcular_estabelecimento(estabelecimento_id: int) -> int:
+        """Reconstrói o snapshot inteiro de um estabelecimento e confirma a transação."""
+        f = Fornecedor.__table__
+        ids = db.session.execute(
+            select(f.c.id).where(f.c.estabelecimento_id == estabelecimento_id)
+        ).scalars().all()
+        snap = FornecedorMetrica.__table__
+        db.session.execute(snap.delete().where(snap.c.estabelecimento_id == estabelecimento_id))
+        gravadas = FornecedorMetricasService.recalcular(ids)
+        db.session.commit()
+        with _lock:
+            _verificados.add(int(estabelecimento_id))
+        return gravadas
+
+    @staticmethod
+    def recalcular_todos() -> Dict[int, int]:
+        """Reconstrói o snapshot de todos os estabelecimentos (CLI / manutenção)."""
+        f = Fornecedor.__table__
+        estabs = db.session.execute(select(f.c.estabelecimento_id).distinct()).scalars().all()
+        return {e: FornecedorMetricasService.recalcular_estabelecimento(e) for e in estabs}
+
+    @staticmethod
+    def garantir_snapshot(estabelecimento_id) -> None:
+        """Na primeira leitura do processo, confere se o snapshot cobre todos os
+        fornecedores do estabelecimento e o reconstrói se não cobrir."""
+        try:
+            estab_id = int(estabelecimento_id)
+        except (TypeError, ValueError):
+            return
+        if estab_id in _verificados:
+            return
+        f, snap = Fornecedor.__table__, FornecedorMetrica.__table__
+        esperados = db.session.execute(
+            select(func.count()).select_from(f)
+            .where(f.c.estabelecimento_id == estab_id, f.c.deleted_at.is_(None))
+        ).scalar() or 0
+        existentes = db.session.execute(
+            select(func.count()).select_from(snap).where(snap.c.estabelecimento_id == estab_id)
+        ).scalar() or 0
+        if esperados != existentes:
+            logger.info(f"Snapshot de fornecedores do estabelecimento {estab_id} desatualizado "
+                        f"({existentes}/{esperados}); reconstruindo.")
+            FornecedorMetricasService.recalcular_estabelecimento(estab_id)
+        with _lock:
+            _verificados.add(estab_id)
+
+    @staticmethod
+    def invalidar(estabelecimento_id=None) -> None:
+        """Força nova conferência do snapshot na próxima leitura."""
+        with _lock:
+            if estabelecimento_id is None:
+                _verificados.clear()
+            else:
+                _verificados.discard(int(estabelecimento_id))
+
+    @staticmethod
+    def filtro_busca(termo: str):
+        """Condição de busca sobre o snapshot: nome/razão/contato/e-mail normalizados ou CNPJ."""
+        termo_norm = normalizar_busca(termo).replace("%", r"\%").replace("_", r"\_")
+        condicoes = [FornecedorMetrica.nome_busca.like(f"%{termo_norm}%", escape="\\")]
+        digitos = re.sub(r"\D", "", termo)
+        if len(digitos) >= 2:
+            condicoes.append(FornecedorMetrica.cnpj_digitos.like(f"{digitos}%"))
+        return or_(*condicoes)
+
+    @staticmethod
+    def serializar(m: Optional[FornecedorMetrica]) -> Dict:
+        """Campos do snapshot anexados ao dicionário do fornecedor nas respostas."""
+        if m is None:
+            return {"classificacao": "NOVO", "ultima_compra": None, "total_pedidos": 0, "valor_comprado": 0.0,
+                    "contas_abertas": 0, "valor_em_aberto": 0.0}
+        return {
+            "classificacao": m.classificacao,
+            "ultima_compra": m.ultima_compra.isoformat() if m.ultima_compra else None,
+            "total_pedidos": m.total_pedidos,
+            "valor_comprado": float(m.valor_comprado or 0),
+            "contas_abertas": m.contas_abertas,
+            "valor_em_aberto": float(m.valor_em_aberto or 0),
+        }
+
+    @staticmethod
+    def estatisticas(estabelecimento_id) -> Dict:
+        """Estatísticas gerais direto do snapshot (agregações sobre uma tabela pequena e indexada)."""
+        m = FornecedorMetrica
+        base = db.session.query(m)
+        if str(estabelecimento_id).lower() != "all":
+            base = base.filter(m.estabelecimento_id == estabelecimento_id)
+
+        total, ativos, valor_comprado, valor_em_aberto, contas_abertas = base.with_entities(
+            func.count(m.id),
+            func.sum(case((m.ativo.is_(True), 1), else_=0)),
+            func.coalesce(func.sum(m.valor_comprado), 0),
+            func.coalesce(func.sum(m.valor_em_aberto), 0),
+            func.coalesce(func.sum(m.contas_abertas), 0),
+        ).one()
+        total, ativos = int(total or 0), int(ativos or 0)
+
+        classificacoes = base.with_entities(m.classificacao, func.count(m.id)).group_by(m.classificacao).all()
+        por_estado = base.with_entities(m.estado, func.count(m.id)).group_by(m.estado).all()
+        top = base.order_by(m.valor_comprado.desc(), m.nome_fantasia.asc()).limit(5).all()
+        ultimos = base.order_by(m.data_cadastro.desc()).limit(5).all()
+
+        return {
+            "estatisticas": {
+                "total": total,
+                "ativos": ativos,
+                "inativos": total - ativos,
+                "percentual_ativos": (ativos / total * 100) if total > 0 else 0,
+                "classificacoes": {c: n for c, n in classificacoes},
+                "por_estado": {e: n for e, n in por_estado},
+                "valor_total_comprado": float(valor_comprado or 0),
+                "valor_em_aberto": float(valor_em_aberto or 0),
+                "contas_abertas": int(contas_abertas or 0),
+            },
+            "top_fornecedores": [
+                {"id": t.fornecedor_id, "nome": t.nome_fantasia, "valor_total": float(t.valor_comprado or 0),
+                 "total_compras": t.total_pedidos}
+                for t in top
+            ],
+            "ultimos_cadastrados": [
+                {"id": u.fornecedor_id, "nome": u.nome_fantasia,
+                 "data_cadastro": u.data_cadastro.isoformat() if u.data_cadastro else None,
+                 "classificacao": u.classificacao}
+                for u in ultimos
+            ],
+        }
@@ -0,0 +1,792 @@
+"""
+Importação em massa de produtos e clientes via CSV (onboarding de lojas).
+
+O upload só grava o arquivo no spool (IMPORTACAO_FOLDER) e cria um job em
+importacoes_arquivos; o processamento roda nos workers (ImportacaoWorker):
+
+- o CSV é lido em blocos de `_LOTE` linhas (csv.DictReader sobre o arquivo,
+  nunca o conteúdo inteiro em memória), com UTF-8 ou Latin-1 do Excel e
+  ';' ou ',' detectados numa primeira passada que também conta as linhas;
+- cada bloco é validado linha a linha e os duplicados são resolvidos com UMA
+  consulta por bloco (códigos de barras/internos ou CPFs do bloco num
+  SELECT ... IN), mais a deduplicação dentro do próprio arquivo;
+- a gravação é um INSERT ... ON CONFLICT em lote (DO NOTHING, ou DO UPDATE
+  com atualizar=true) — sem ORM por linha, logo sem o listener forense por
+  registro: a auditoria é um evento-resumo por importação;
+- o bloco é commitado junto com o avanço de linhas_processadas: um job
+  interrompido retoma do bloco seguinte, sem duplicar o que já entrou;
+- erros são por linha (linha do arquivo + motivo, até `_MAX_ERROS`) e não
+  interrompem o resto; simular=true faz tudo isso sem gravar e o resultado
+  pode depois ser confirmado sem reenviar o arquivo.
+
+Sem workers no processo (TESTING/IMPORTACAO_WORKERS=0) o job roda em linha,
+logo após ser agendado. O INSERT ... ON CONFLICT exige PostgreSQL ou SQLite.
+"""
+from __future__ import annotations
+
+import csv
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from flask import current_app, jsonify
+from sqlalchemy import func, or_, select
+
+from app.models import (
+    db, Auditoria, CatalogoMestre, CategoriaProduto, Cliente, ContaReceber, Estabelecimento, ImportacaoArquivo, Produto,
+    ProdutoLote, utcnow,
+)
+from app.services import catalogo_mestre_service as catalogo_mestre
+from app.services.financeiro_mensal_service import FinanceiroMensalService
+from app.utils import calcular_margem_lucro, formatar_codigo_barras, formatar_telefone, validar_cpf
+
+logger = logging.getLogger(__name__)
+
+TIPOS = ("produtos", "clientes")
+
+_WORKERS = int(os.getenv("IMPORTACAO_WORKERS", "1"))
+_MAX_TENTATIVAS = int(os.getenv("IMPORTACAO_MAX_TENTATIVAS", "3"))
+_BACKOFF_BASE = 60.0
+_LEASE_SEC = 600  # renovado a cada bloco
+_VALIDADE_HORAS = int(os.getenv("IMPORTACAO_VALIDADE_HORAS", "24"))  # spool de jobs encerrados
+_LOTE = 1000  # linhas por bloco (uma consulta de duplicados + um INSERT em lote)
+_MAX_ERROS = 500
+_POLL_SEC = 10.0
+
+_acordar = threading.Event()
+_workers: List["ImportacaoWorker"] = []
+
+_ALIASES = {
+    "ean": "codigo_barras", "gtin": "codigo_barras", "codigo_de_barras": "codigo_barras",
+    "codigo": "codigo_interno", "quantidade": "estoque", "validade": "data_validade",
+    "unidade_medida": "unidade", "estoque_minimo": "quantidade_minima", "uf": "estado",
+}
+_FORMATOS_DATA = ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y")
+
+
+class ArquivoInvalido(ValueError):
+    """Problema no arquivo como um todo (cabeçalho, codificação): o job falha sem retentar."""
+
+
+# ---------------------------------------------------------------- leitura
+
+def _verdadeiro(valor) -> bool:
+    return str(valor or "").strip().lower() in ("1", "true", "sim", "on")
+
+
+def _normalizar_coluna(nome: Optional[str]) -> str:
+    nome = unicodedata.normalize("NFKD", (nome or "").strip().lower()).encode("ascii", "ignore").decode()
+    nome = re.sub(r"[^a-z0-9]+", "_", nome).strip("_")
+    return _ALIASES.get(nome, nome)
+
+
+def _inspecionar(caminho: str) -> Tuple[str, str, int]:
+    """Primeira passada (binária, linha a linha): codificação, delimitador e
+    quantas linhas de dados há — para o progresso do job."""
+    codificacao, total = "utf-8-sig", 0
+    with open(caminho, "rb") as f:
+        cabecalho = f.readline()
+        for linha in f:
+            if linha.strip():
+                total += 1
+            if codificacao != "latin-1":
+                try:
+                    linha.decode("utf-8")
+                except UnicodeDecodeError:
+                    codificacao = "latin-1"  # CSV salvo pelo Excel em PT-BR
+    try:
+        texto = cabecalho.decode(codificacao)
+    except UnicodeDecodeError:
+        codificacao, texto = "latin-1", cabecalho.decode("latin-1")
+    if not texto.strip():
+        raise ArquivoInvalido("Arquivo vazio ou sem cabeçalho")
+    return codificacao, ";" if texto.count(";") >= texto.count(",") else ",", total
+
+
+def _blocos(leitor: csv.DictReader, tamanho: int, pular: int = 0) -> Iterator[List[Tuple[int, dict]]]:
+    """Blocos de (linha do arquivo, registro), a partir da linha de dados `pular`."""
+    bloco: List[Tuple[int, dict]] = []
+    for indice, registro in enumerate(leitor):
+        if indice < pular:
+            continue
+        bloco.append((leitor.line_num, registro))
+        if len(bloco) >= tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def _texto(registro: dict, campo: str, maximo: Optional[int] = None) -> Optional[str]:
+    valor = registro.get(campo)
+    valor = valor.strip() if isinstance(valor, str) else ""
+    if not valor:
+        return None
+    return valor[:maximo] if maximo else valor
+
+
+def _decimal(registro: dict, campo: str, padrao: Optional[Decimal] = Decimal("0")) -> Optional[Decimal]:
+    bruto = _texto(registro, campo)
+    if bruto is None:
+        return padrao
+    texto = bruto.replace("R$", "").replace(" ", "")
+    if "," in texto:  # 1.234,56
+        texto = texto.replace(".", "").replace(",", ".")
+    try:
+        numero = Decimal(texto)
+    except InvalidOperation:
+        raise ValueError(f"{campo} inválido: '{bruto}'")
+    if numero < 0:
+        raise ValueError(f"{campo} não pode ser negativo")
+    return numero
+
+
+def _data(registro: dict, campo: str) -> Optional[date]:
+    bruto = _texto(registro, campo)
+    if bruto is None:
+        return None
+    for formato in _FORMATOS_DATA:
+        try:
+            return datetime.strptime(bruto, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Formato de data inválido para '{bruto}'")
+
+
+def _vazio(registro: dict) -> bool:
+    return not any(isinstance(v, str) and v.strip() for v in registro.values())
+
+
+# ---------------------------------------------------------------- gravação em lote
+
+def _insert(tabela):
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialeto == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Importação em massa não suportada no banco '{dialeto}'")
+    return insert(tabela)
+
+
+def _upsert(tabela, linhas: List[dict], chave: Optional[Sequence[str]] = None,
+            atualizar: Optional[Callable] = None, retornar: bool = True) -> Dict[str, int]:
+    """INSERT ... ON CONFLICT em lote (executemany). Com `atualizar(excluded)`
+    vira DO UPDATE sobre a constraint `chave`; sem ele, DO NOTHING.
+
+    Retorna {sync_uuid: id} do que foi gravado: linhas inseridas voltam com o
+    sync_uuid que mandamos, atualizadas com o da linha que já existia."""
+    if not linhas:
+        return {}
+    stmt = _insert(tabela)
+    if atualizar is not None:
+        stmt = stmt.on_conflict_do_update(index_elements=list(chave), set_=atualizar(stmt.excluded))
+    else:
+        stmt = stmt.on_conflict_do_nothing()
+    if not retornar:
+        db.session.execute(stmt, linhas)
+        return {}
+    return {u: i for i, u in db.session.execute(stmt.returning(tabela.c.id, tabela.c.sync_uuid), linhas)}
+
+
+# ---------------------------------------------------------------- importadores
+
+class _Importador:
+    """Processa um bloco: valida, deduplica (no arquivo e no banco) e grava.
+
+    `processar` devolve (inseridos, atualizados, erros); em simulação as
+    contagens são do que SERIA gravado e nada é escrito."""
+    tipo = ""
+    obrigatorias: Tuple[str, ...] = ()
+
+    def __init__(self, estabelecimento_id: int, simulacao: bool = False, atualizar: bool = False):
+        self.estabelecimento_id = estabelecimento_id
+        self.simulacao = simulacao
+        self.atualizar = atualizar
+        self._vistos: Dict[Tuple[str, str], int] = {}
+
+    def validar_cabecalho(self, colunas: Sequence[str]) -> None:
+        faltando = [c for c in self.obrigatorias if c not in colunas]
+        if faltando:
+            raise ArquivoInvalido(f"Colunas obrigatórias ausentes: {', '.join(faltando)}")
+
+    def _marcar(self, tipo: str, valor: Optional[str], linha: int, rotulo: str) -> None:
+        """Deduplicação dentro do arquivo: a primeira ocorrência vale."""
+        if not valor:
+            return
+        anterior = self._vistos.get((tipo, valor))
+        if anterior is not None:
+            raise ValueError(f"{rotulo} {valor} repetido no arquivo (linha {anterior})")
+        self._vistos[(tipo, valor)] = linha
+
+    def _validar(self, bloco) -> Tuple[List[Tuple[int, dict]], List[dict]]:
+        validas, erros = [], []
+        for linha, registro in bloco:
+            if _vazio(registro):
+                continue
+            try:
+                validas.append((linha, self.ler(registro, linha)))
+            except ValueError as e:
+                erros.append({"linha": linha, "erro": str(e)})
+        return validas, erros
+
+    def ler(self, registro: dict, linha: int) -> dict:
+        raise NotImplementedError
+
+    def processar(self, bloco) -> Tuple[int, int, List[dict]]:
+        raise NotImplementedError
+
+
+class ImportadorProdutos(_Importador):
+    tipo = "produtos"
+    obrigatorias = ("nome", "categoria", "preco_venda")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._categorias: Dict[str, int] = {}
+        self._lotes_usados: set = set()
+
+    def ler(self, registro, linha):
+        nome = _texto(registro, "nome", 100)
+        if not nome:
+            raise ValueError("Nome do produto é obrigatório")
+        categoria = _texto(registro, "categoria", 50)
+        if not categoria:
+            raise ValueError("Categoria é obrigatória")
+        preco_venda = _decimal(registro, "preco_venda", None)
+        if not preco_venda:
+            raise ValueError("Preço de venda é obrigatório")
+        preco_custo = _decimal(registro, "preco_custo")
+        data_validade = _data(registro, "data_validade")
+        dados = {
+            "codigo_barras": formatar_codigo_barras(_texto(registro, "codigo_barras"))[:50] or None,
+            "codigo_interno": _texto(registro, "codigo_interno", 50),
+            "nome": nome, "categoria": categoria, "marca": _texto(registro, "marca", 50),
+            "unidade_medida": (_texto(registro, "unidade", 20) or "UN").upper(),
+            "preco_custo": preco_custo, "preco_venda": preco_venda,
+            "margem_lucro": Decimal(str(calcular_margem_lucro(preco_venda, preco_custo))),
+            "quantidade": _decimal(registro, "estoque"),
+            "quantidade_minima": _decimal(registro, "quantidade_minima", Decimal("10")),
+            "ncm": re.sub(r"\D", "", _texto(registro, "ncm") or "")[:8] or None,
+            "lote": _texto(registro, "lote", 40), "data_validade": data_validade,
+            "controlar_validade": data_validade is not None, "imagem_url": None,
+        }
+        self._marcar("ean", dados["codigo_barras"], linha, "Código de barras")
+        self._marcar("codigo", dados["codigo_interno"], linha, "Código interno")
+        return dados
+
+    def _ids_categorias(self, nomes: Iterable[str]) -> Dict[str, int]:
+        """Uma consulta para as categorias do bloco; as que faltam são criadas em lote."""
+        t = CategoriaProduto.__table__
+        faltando = [n for n in dict.fromkeys(nomes) if n not in self._categorias]
+        if not faltando:
+            return self._categorias
+
+        def _buscar():
+            self._categorias.update(db.session.execute(
+                select(t.c.nome, t.c.id).where(t.c.estabelecimento_id == self.estabelecimento_id, t.c.nome.in_(faltando))
+            ).all())
+        _buscar()
+        novas = [n for n in faltando if n not in self._categorias]
+        if novas and not self.simulacao:
+            _upsert(t, [{"estabelecimento_id": self.estabelecimento_id, "nome": n, "ativo": True} for n in novas],
+                    retornar=False)
+            _buscar()
+        return self._categorias
+
+    @staticmethod
+    def _set_atualizacao(excluded):
+        t = Produto.__table__
+        return {
+            "nome": excluded.nome, "categoria_id": excluded.categoria_id, "preco_custo": excluded.preco_custo,
+            "preco_venda": excluded.preco_venda, "margem_lucro": excluded.margem_lucro,
+            "quantidade_minima": excluded.quantidade_minima, "unidade_medida": excluded.unidade_medida,
+            "marca": func.coalesce(excluded.marca, t.c.marca), "ncm": func.coalesce(excluded.ncm, t.c.ncm),
+            "imagem_url": func.coalesce(excluded.imagem_url, t.c.imagem_url),
+            "ativo": True, "deleted_at": None, "updated_at": utcnow(),
+        }
+
+    def processar(self, bloco):
+        validas, erros = self._validar(bloco)
+        if not validas:
+            return 0, 0, erros
+        t = Produto.__table__
+        eans = {d["codigo_barras"] for _, d in validas if d["codigo_barras"]}
+        codigos = {d["codigo_interno"] for _, d in validas if d["codigo_interno"]}
+        por_ean, por_codigo = {}, {}
+        if eans or codigos:
+            for id_, ean, codigo in db.session.execute(
+                select(t.c.id, t.c.codigo_barras, t.c.codigo_interno).where(
+                    t.c.estabelecimento_id == self.estabelecimento_id,
+                    or_(t.c.codigo_barras.in_(eans), t.c.codigo_interno.in_(codigos)))
+            ):
+                if ean:
+                    por_ean[ean] = id_
+                if codigo:
+                    por_codigo[codigo] = id_
+
+        # Classificação: novo, atualização (atualizar=true) ou erro de duplicidade
+        novos, existentes = [], []
+        for linha, d in validas:
+            ean, codigo = d["codigo_barras"], d["codigo_interno"]
+            alvo = por_ean.get(ean) if ean else por_codigo.get(codigo)
+            if codigo and codigo in por_codigo and por_codigo[codigo] != alvo:
+                erros.append({"linha": linha, "erro": f"Código interno {codigo} já cadastrado em outro produto"})
+            elif alvo is None:
+                novos.append((linha, d))
+            elif self.atualizar:
+                existentes.append((linha, d))
+            else:
+                rotulo = f"Código de barras {ean}" if ean else f"Código interno {codigo}"
+                erros.append({"linha": linha, "erro": f"{rotulo} já cadastrado"})
+
+        # Catálogo mestre: um SELECT ... IN (via cache) completa marca/NCM/imagem em branco
+        catalogo = catalogo_mestre.buscar_eans(
+            d["codigo_barras"] for _, d in novos + existentes if catalogo_mestre._ean_valido(d["codigo_barras"]))
+        for _, d in novos + existentes:
+            item = catalogo.get(d["codigo_barras"] or "")
+            if item and item.get("status") == "encontrado":
+                d["marca"] = d["marca"] or (item.get("marca") or "")[:50] or None
+                d["ncm"] = d["ncm"] or item.get("ncm")
+                d["imagem_url"] = item.get("imagem_url")
+
+        if self.simulacao:
+            return len(novos), len(existentes), erros
+
+        categorias = self._ids_categorias(d["categoria"] for _, d in novos + existentes)
+        linhas = {}
+        for linha, d in novos + existentes:
+            linhas[linha] = {
+                "estabelecimento_id": self.estabelecimento_id, "categoria_id": categorias[d["categoria"]],
+                "sync_uuid": str(uuid.uuid4()),
+                **{k: v for k, v in d.items() if k != "categoria"},
+            }
+        gravados: Dict[str, int] = {}
+        if self.atualizar:
+            com_ean = [linhas[n] for n, d in novos + existentes if d["codigo_barras"]]
+            so_codigo = [linhas[n] for n, d in novos + existentes if not d["codigo_barras"] and d["codigo_interno"]]
+            sem_chave = [linhas[n] for n, d in novos if not d["codigo_barras"] and not d["codigo_interno"]]
+            gravados.update(_upsert(t, com_ean, ("estabelecimento_id", "codigo_barras"), self._set_atualizacao))
+            gravados.update(_upsert(t, so_codigo, ("estabelecimento_id", "codigo_interno"), self._set_atualizacao))
+            gravados.update(_upsert(t, sem_chave))
+        else:
+            gravados = _upsert(t, [linhas[n] for n, _ in novos])
+
+        inseridos = [(n, d) for n, d in novos if linhas[n]["sync_uuid"] in gravados]
+        if not self.atualizar:
+            # Cadastrado por outra requisição entre a consulta e o INSERT (DO NOTHING)
+            erros.extend({"linha": n, "erro": "Produto já cadastrado"} for n, _ in novos
+                         if linhas[n]["sync_uuid"] not in gravados)
+        self._gravar_lotes([(gravados[linhas[n]["sync_uuid"]], d) for n, d in inseridos])
+        self._catalogar([d for _, d in inseridos if d["codigo_barras"] not in catalogo])
+        return len(inseridos), len(gravados) - len(inseridos), erros
+
+    def _catalogar(self, produtos: List[dict]) -> None:
+        """EANs novos alimentam o catálogo mestre (como no cadastro), num INSERT em
+        lote que nunca sobrescreve item já catalogado (DO NOTHING em ean)."""
+        itens = {}
+        for d in produtos:
+            if catalogo_mestre._ean_valido(d["codigo_barras"]) and d["codigo_barras"] not in itens:
+                itens[d["codigo_barras"]] = {
+                    "ean": d["codigo_barras"], "nome": d["nome"], "marca": d["marca"], "fabricante": None,
+                    "ncm": d["ncm"], "categoria": d["categoria"], "unidade": d["unidade_medida"],
+                    "imagem_url": d["imagem_url"], "fonte": "tenant", "status": "encontrado",
+                    "descoberto_por_estabelecimento_id": self.estabelecimento_id, "descoberto_via": "importacao_csv",
+                }
+        if itens:
+            _upsert(CatalogoMestre.__table__, list(itens.values()), retornar=False)
+            catalogo_mestre.esquecer(itens)  # derruba um eventual 404 da Cosmos em cache
+
+    def _gravar_lotes(self, produtos: List[Tuple[int, dict]]) -> None:
+        """Primeiro lote dos produtos novos com estoque (mesma regra do cadastro)."""
+        produtos = [(i, d) for i, d in produtos if d["quantidade"] > 0]
+        if not produtos:
+            return
+        t = ProdutoLote.__table__
+        informados = {d["lote"] for _, d in produtos if d["lote"]}
+        if informados:
+            self._lotes_usados.update(db.session.execute(
+                select(t.c.numero_lote).where(t.c.estabelecimento_id == self.estabelecimento_id,
+                                              t.c.numero_lote.in_(informados))
+            ).scalars())
+        hoje = date.today()
+        linhas = []
+        for produto_id, d in produtos:
+            numero = d["lote"]
+            if not numero or numero in self._lotes_usados:
+                numero = f"{numero or 'IMPORT-' + hoje.strftime('%Y%m%d')}-{produto_id}"
+            self._lotes_usados.add(numero)
+            linhas.append({
+                "estabelecimento_id": self.estabelecimento_id, "produto_id": produto_id, "numero_lote": numero[:50],
+                "quantidade": d["quantidade"], "quantidade_inicial": d["quantidade"],
+                "data_validade": d["data_validade"] or hoje + timedelta(days=365),
+                "data_entrada": hoje, "preco_custo_unitario": d["preco_custo"], "preco_venda": d["preco_venda"],
+                "ativo": True,
+            })
+        _upsert(t, linhas, retornar=False)
+
+
+class ImportadorClientes(_Importador):
+    tipo = "clientes"
+    obrigatorias = ("nome", "cpf")
+    # Colunas NOT NULL sem valor no arquivo: marcador neutro (como no cadastro rápido);
+    # numa atualização o marcador nunca sobrescreve o que já estava gravado.
+    _MARCADORES = {"celular": "(00) 00000-0000", "cep": "00000-000", "logradouro": "Não informado",
+                   "numero": "S/N", "bairro": "Não informado", "cidade": "Não informado"}
+    _LIMITES = {"celular": 30, "cep": 9, "logradouro": 200, "numero": 10, "bairro": 100, "cidade": 100}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        estab = db.session.get(Estabelecimento, self.estabelecimento_id)
+        self._uf_padrao = ((estab.estado if estab else None) or "AM")[:2].upper()
+
+    def ler(self, registro, linha):
+        nome = _texto(registro, "nome", 150)
+        if not nome:
+            raise ValueError("Nome é obrigatório")
+        cpf = re.sub(r"\D", "", _texto(registro, "cpf") or "")
+        if not validar_cpf(cpf):
+            raise ValueError(f"CPF inválido: '{_texto(registro, 'cpf') or ''}'")
+        cpf = f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
+        self._marcar("cpf", cpf, linha, "CPF")
+        email = (_texto(registro, "email", 100) or "").lower() or None
+        dados = {
+            "nome": nome, "cpf": cpf, "email": email,
+            "telefone": formatar_telefone(_texto(registro, "telefone") or "")[:30] or None,
+            "data_nascimento": _data(registro, "data_nascimento"),
+            "limite_credito": _decimal(registro, "limite_credito"),
+            "saldo_devedor": _decimal(registro, "saldo_devedor"),
+            "complemento": _texto(registro, "complemento", 100),
+            "estado": (_texto(registro, "estado", 2) or self._uf_padrao).upper(),
+        }
+        for campo, marcador in self._MARCADORES.items():
+            valor = _texto(registro, campo)
+            if campo == "celular" and valor:
+                valor = formatar_telefone(valor)
+            dados[campo] = (valor or marcador)[:self._LIMITES[campo]]
+        return dados
+
+    @classmethod
+    def _set_atualizacao(cls, excluded):
+        t = Cliente.__table__
+        valores = {
+            "nome": excluded.nome, "limite_credito": excluded.limite_credito,
+            "email": func.coalesce(excluded.email, t.c.email),
+            "telefone": func.coalesce(excluded.telefone, t.c.telefone),
+            "data_nascimento": func.coalesce(excluded.data_nascimento, t.c.data_nascimento),
+            "complemento": func.coalesce(excluded.complemento, t.c.complemento),
+            "ativo": True, "deleted_at": None, "updated_at": utcnow(), "data_atualizacao": utcnow(),
+        }
+        for campo, marcador in cls._MARCADORES.items():
+            valores[campo] = func.coalesce(func.nullif(getattr(excluded, campo), marcador), getattr(t.c, campo))
+        return valores
+
+    def processar(self, bloco):
+        validas, erros = self._validar(bloco)
+        if not validas:
+            return 0, 0, erros
+        t = Cliente.__table__
+        existentes = set(db.session.execute(
+            select(t.c.cpf).where(t.c.estabelecimento_id == self.estabelecimento_id,
+                                  t.c.cpf.in_({d["cpf"] for _, d in validas}))
+        ).scalars())
+        novos, atualizacoes = [], []
+        for linha, d in validas:
+            if d["cpf"] not in existentes:
+                novos.append((linha, d))
+            elif self.atualizar:
+                atualizacoes.append((linha, d))
+            else:
+                erros.append({"linha": linha, "erro": f"CPF {d['cpf']} já cadastrado"})
+        if self.simulacao:
+            return len(novos), len(atualizacoes), erros
+
+        linhas = {}
+        for linha, d in novos + atualizacoes:
+            linhas[linha] = {
+                "estabelecimento_id": self.estabelecimento_id, "sync_uuid": str(uuid.uuid4()), "ativo": True,
+                "total_compras": 0, "valor_total_gasto": Decimal("0"), **d,
+            }
+        gravados = _upsert(t, list(linhas.values()), ("estabelecimento_id", "cpf"),
+                           self._set_atualizacao if self.atualizar else None)
+        inseridos = [(gravados[linhas[n]["sync_uuid"]], d) for n, d in novos if linhas[n]["sync_uuid"] in gravados]
+        if not self.atualizar:
+            erros.extend({"linha": n, "erro": f"CPF {d['cpf']} já cadastrado"} for n, d in novos
+                         if linhas[n]["sync_uuid"] not in gravados)
+
+        # Fiado antigo (saldo devedor inicial) vira conta a receber do cliente novo
+        hoje = date.today()
+        contas = _upsert(ContaReceber.__table__, [{
+            "estabelecimento_id": self.estabelecimento_id, "cliente_id": cliente_id,
+            "numero_documento": f"MIG-{cliente_id}", "tipo_documento": "migracao",
+            "valor_original": d["saldo_devedor"], "valor_recebido": Decimal("0"), "valor_atual": d["saldo_devedor"],
+            "data_emissao": hoje, "data_vencimento": hoje + timedelta(days=30), "status": "aberto",
+            "observacoes": "Migração de saldo inicial (importação CSV)", "sync_uuid": str(uuid.uuid4()),
+        } for cliente_id, d in inseridos if d["saldo_devedor"] > 0])
+        if contas:
+            # INSERT em lote não passa pelos listeners do razão financeiro: soma aqui, na mesma transação
+            conn = db.session.connection()
+            FinanceiroMensalService.aplicar_deltas(
+                {}, FinanceiroMensalService.contribuicoes({"contas_receber": contas.values()}, conn), conn)
+        return len(inseridos), len(gravados) - len(inseridos), erros
+
+
+_IMPORTADORES = {"produtos": ImportadorProdutos, "clientes": ImportadorClientes}
+
+
+# ---------------------------------------------------------------- jobs
+
+def _apagar(*caminhos: str) -> None:
+    for caminho in caminhos:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+def _pasta_importacoes() -> str:
+    pasta = current_app.config.get("IMPORTACAO_FOLDER") or os.path.join(current_app.instance_path, "imports")
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+def backoff(tentativas: int) -> float:
+    return _BACKOFF_BASE * (2 ** max(0, tentativas - 1))
+
+
+def resposta(job: ImportacaoArquivo):
+    """Corpo/status HTTP do job; concluído em linha mantém o contrato antigo do /importar."""
+    corpo = {"success": job.status != "falhou", "importacao": job.to_dict()}
+    if job.status == "falhou":
+        corpo["message"] = job.ultimo_erro or "Falha na importação"
+        return jsonify(corpo), 400
+    if job.status != "concluido":
+        corpo["message"] = "Importação em processamento"
+        return jsonify(corpo), 202
+    verbo = "Simulação concluída" if job.simulacao else "Importação concluída"
+    corpo.update({
+        "message": f"{verbo}: {job.inseridos} novos, {job.atualizados} atualizados, {job.rejeitados} erros.",
+        "total_importados": job.inseridos + job.atualizados,
+        "total_erros": job.rejeitados,
+        "erros": [f"Linha {e['linha']}: {e['erro']}" for e in job.erros[:10]],
+    })
+    return jsonify(corpo), 200
+
+
+def responder(tipo: str, arquivo, estabelecimento_id: int, opcoes, funcionario_id=None):
+    """Atende um POST /importar: agenda o job com as opções `simular` e
+    `atualizar` da requisição e devolve `resposta(job)`."""
+    job = ImportacaoService.agendar(tipo, arquivo, estabelecimento_id, funcionario_id,
+                                    simulacao=_verdadeiro(opcoes.get("simular")),
+                                    atualizar=_verdadeiro(opcoes.get("atualizar")))
+    return resposta(job)
+
+
+class ImportacaoService:
+
+    @staticmethod
+    def ativa() -> bool:
+        """Há workers neste processo? Sem eles o job roda em linha."""
+        return any(w.is_alive() for w in _workers)
+
+    @staticmethod
+    def agendar(tipo: str, arquivo, estabelecimento_id: int, funcionario_id=None, simulacao: bool = False,
+                atualizar: bool = False) -> ImportacaoArquivo:
+        """Grava o upload no spool (em blocos, pelo FileStorage), cria o job e despacha."""
+        if tipo not in TIPOS:
+            raise ValueError(f"Importação desconhecida: {tipo}")
+        handle = uuid.uuid4().hex
+        caminho = os.path.join(_pasta_importacoes(), f"{handle}.csv")
+        arquivo.save(caminho)
+        job = ImportacaoArquivo(
+            handle=handle, estabelecimento_id=estabelecimento_id,
+            funcionario_id=int(funcionario_id) if str(funcionario_id or "").isdigit() else None,
+            tipo=tipo, nome_arquivo=(arquivo.filename or f"{tipo}.csv")[:200], caminho=caminho,
+            simulacao=bool(simulacao), atualizar_existentes=bool(atualizar), status="pendente",
+            proxima_tentativa_em=utcnow(),
+        )
+        db.session.add(job)
+        db.session.commit()
+        return ImportacaoService._despachar(job)
+
+    @staticmethod
+    def _despachar(job: ImportacaoArquivo) -> ImportacaoArquivo:
+        if ImportacaoService.ativa():
+            _acordar.set()
+        else:
+            ImportacaoService.processar_pendentes(ids=[job.id])
+            db.session.refresh(job)
+        return job
+
+    @staticmethod
+    def confirmar(job: ImportacaoArquivo) -> ImportacaoArquivo:
+        """Executa de verdade uma simulação concluída, com o mesmo arquivo do spool."""
+        if not job.simulacao or job.status != "concluido":
+            raise ValueError("Só uma simulação concluída pode ser confirmada")
+        if not job.caminho or not os.path.exists(job.caminho):
+            raise ValueError("Arquivo da simulação expirou; envie o CSV novamente")
+        t = ImportacaoArquivo.__table__
+        db.session.execute(t.update().where(t.c.id == job.id).values(
+            simulacao=False, status="pendente", tentativas=0, proxima_tentativa_em=utcnow(), ultimo_erro=None,
+            total_linhas=None, linhas_processadas=0, inseridos=0, atualizados=0, rejeitados=0, erros_json=None,
+            iniciado_em=None, concluido_em=None,
+        ))
+        db.session.commit()
+        db.session.refresh(job)
+        return ImportacaoService._despachar(job)
+
+    @staticmethod
+    def _reivindicar(limite: int, ids: Optional[Iterable[int]] = None) -> List[int]:
+        t = ImportacaoArquivo.__table__
+        agora = utcnow()
+        # "processando" com lease vencido: worker que caiu no meio; retoma do último bloco
+        vencidos = (t.c.status.in_(("pendente", "processando")),
+                    or_(t.c.proxima_tentativa_em.is_(None), t.c.proxima_tentativa_em <= agora))
+        if ids is None:
+            ids = db.session.execute(
+                select(t.c.id).where(*vencidos).order_by(t.c.proxima_tentativa_em, t.c.id).limit(limite)
+            ).scalars().all()
+        ids = list(ids)
+        if not ids:
+            return []
+        reivindicados = db.session.execute(
+            t.update().where(t.c.id.in_(ids), *vencidos)
+            .values(proxima_tentativa_em=agora + timedelta(seconds=_LEASE_SEC), tentativas=t.c.tentativas + 1)
+            .returning(t.c.id)
+        ).scalars().all()
+        db.session.commit()
+        return sorted(reivindicados)
+
+    @staticmethod
+    def processar_pendentes(limite: int = 1, ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+        """Processa um lote de jobs. Retorna contagem por status."""
+        contagem: Dict[str, int] = {}
+        for job_id in ImportacaoService._reivindicar(limite, ids):
+            status = ImportacaoService._processar_um(job_id)
+            contagem[status] = contagem.get(status, 0) + 1
+        return contagem
+
+    @staticmethod
+    def _processar_um(job_id: int) -> str:
+        t = ImportacaoArquivo.__table__
+        job = db.session.execute(select(t).where(t.c.id == job_id)).mappings().one()
+        try:
+            codificacao, delimitador, total = _inspecionar(job["caminho"])
+            db.session.execute(t.update().where(t.c.id == job_id).values(
+                status="processando", total_linhas=total, iniciado_em=job["iniciado_em"] or utcnow()))
+            db.session.commit()
+
+            importador = _IMPORTADORES[job["tipo"]](job["estabelecimento_id"], job["simulacao"],
+                                                    job["atualizar_existentes"])
+            erros = json.loads(job["erros_json"] or "[]")
+            with open(job["caminho"], encoding=codificacao, newline="") as f:
+                leitor = csv.DictReader(f, delimiter=delimitador)
+                leitor.fieldnames = [_normalizar_coluna(c) for c in (leitor.fieldnames or [])]
+                importador.validar_cabecalho(leitor.fieldnames)
+                for bloco in _blocos(leitor, _LOTE, pular=job["linhas_processadas"]):
+                    inseridos, atualizados, erros_bloco = importador.processar(bloco)
+                    erros.extend(erros_bloco[:max(0, _MAX_ERROS - len(erros))])
+                    # Mesmo commit dos dados do bloco: a retomada nunca repete nem pula linhas
+                    db.session.execute(t.update().where(t.c.id == job_id).values(
+                        linhas_processadas=t.c.linhas_processadas + len(bloco),
+                        inseridos=t.c.inseridos + inseridos, atualizados=t.c.atualizados + atualizados,
+                        rejeitados=t.c.rejeitados + len(erros_bloco), erros_json=json.dumps(erros, ensure_ascii=False),
+                        proxima_tentativa_em=utcnow() + timedelta(seconds=_LEASE_SEC),
+                    ))
+                    db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            definitivo = isinstance(e, ArquivoInvalido) or job["tentativas"] >= _MAX_TENTATIVAS
+            db.session.execute(t.update().where(t.c.id == job_id).values(
+                status="falhou" if definitivo else "pendente", ultimo_erro=str(e)[:1000],
+                proxima_tentativa_em=None if definitivo else utcnow() + timedelta(seconds=backoff(job["tentativas"])),
+                concluido_em=utcnow() if definitivo else None,
+            ))
+            db.session.commit()
+            logger.error(f"[IMPORTAÇÃO] {job['handle']} (tentativa {job['tentativas']}): {e}")
+            return "falhou" if definitivo else "pendente"
+
+        final = db.session.execute(select(t).where(t.c.id == job_id)).mappings().one()
+        db.session.execute(t.update().where(t.c.id == job_id).values(
+            status="concluido", ultimo_erro=None, proxima_tentativa_em=None, concluido_em=utcnow(),
+            caminho=final["caminho"] if job["simulacao"] else None,  # simulação guarda o arquivo p/ confirmar
+        ))
+        if not job["simulacao"]:
+            Auditoria.registrar(
+                estabelecimento_id=job["estabelecimento_id"],
+                tipo_evento="produto_importado" if job["tipo"] == "produtos" else "cliente_importado",
+                descricao=f"Importação de {job['tipo']} via CSV: {final['inseridos']} novos, "
+                          f"{final['atualizados']} atualizados, {final['rejeitados']} erros",
+                usuario_id=job["funcionario_id"], valor=Decimal("0"),
+                detalhes={"handle": job["handle"], "arquivo": job["nome_arquivo"], "inseridos": final["inseridos"],
+                          "atualizados": final["atualizados"], "erros": final["rejeitados"], "metodo": "import_bulk"},
+            )
+        db.session.commit()
+        if not job["simulacao"]:
+            _apagar(job["caminho"])
+        return "concluido"
+
+    @staticmethod
+    def localizar(handle: str, tipo: str, estabelecimento_id) -> Optional[ImportacaoArquivo]:
+        """Job do tenant (super admin em 'all' enxerga todos)."""
+        consulta = select(ImportacaoArquivo).where(ImportacaoArquivo.handle == handle, ImportacaoArquivo.tipo == tipo)
+        if str(estabelecimento_id).lower() != "all":
+            consulta = consulta.where(ImportacaoArquivo.estabelecimento_id == estabelecimento_id)
+        return db.session.execute(consulta).scalar()
+
+    @staticmethod
+    def limpar_expirados() -> int:
+        """Apaga do spool os arquivos de jobs encerrados há mais de _VALIDADE_HORAS (o registro fica)."""
+        t = ImportacaoArquivo.__table__
+        vencidos = db.session.execute(
+            select(t.c.id, t.c.caminho).where(
+                t.c.status.in_(("concluido", "falhou")), t.c.caminho.isnot(None),
+                t.c.concluido_em < utcnow() - timedelta(hours=_VALIDADE_HORAS))
+        ).all()
+        if not vencidos:
+            return 0
+        _apagar(*[c for _, c in vencidos])
+        db.session.execute(t.update().where(t.c.id.in_([i for i, _ in vencidos])).values(caminho=None))
+        db.session.commit()
+        return len(vencidos)
+
+
+class ImportacaoWorker(threading.Thread):
+    def __init__(self, app, indice: int):
+        super().__init__(name=f"importacao-{indice}")
+        self.app = app
+        self.daemon = True
+
+    def run(self):
+        while True:
+            _acordar.wait(timeout=_POLL_SEC)
+            _acordar.clear()
+            try:
+                with self.app.app_context():
+                    while ImportacaoService.processar_pendentes():
+                        pass
+                    ImportacaoService.limpar_expirados()
+            except Exception as e:
+                self.app.logger.error(f"[IMPORTAÇÃO] Erro no ciclo de importações: {e}")
+
+
+def start_importacoes(app):
+    """Inicia os workers de importação. Retorna a lista de threads (vazia se desabilitado)."""
+    if app.config.get("TESTING") or _WORKERS <= 0:
+        app.logger.info("[IMPORTAÇÃO] Workers NÃO iniciados (desabilitado); jobs processados em linha.")
+        return []
+    if not _workers:
+        for i in range(_WORKERS):
+            worker = ImportacaoWorker(app, i)
+            worker.start()
+            _workers.append(worker)
+        app.logger.info(f"[IMPORTAÇÃO] {_WORKERS} worker(s) de importação iniciado(s).")
+    return list(_workers)
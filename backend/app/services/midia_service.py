@@ -0,0 +1,388 @@
+"""
+Pipeline de mídia: selfies do ponto, documentos de justificativa (RH) e
+documentos de motorista/veículo (delivery).
+
+A requisição só grava o arquivo no spool local e devolve um handle:
+`MidiaService.receber_base64`/`receber_arquivo` decodificam/copiam em blocos
+direto para o disco (o arquivo inteiro nunca fica em memória) e o registro de
+destino recebe a URL provisória /uploads/midia/<handle>, que já serve o
+arquivo do spool. Workers (MidiaWorker) depois:
+
+- reduzem imagens para no máximo MIDIA_LADO_MAX px e recomprimem em WebP,
+  gerando também uma miniatura WebP (PDFs seguem como vieram);
+- publicam no Cloudinary (CLOUDINARY_URL) ou na pasta de uploads, com retry e
+  backoff exponencial — na última tentativa cai para o disco local, como o
+  upload síncrono fazia;
+- gravam a URL final no registro de destino (se ainda for a provisória).
+
+Sem workers no processo (TESTING/MIDIA_WORKERS=0) o processamento acontece em
+linha, logo após o commit da requisição (`MidiaService.despachar`).
+"""
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import threading
+import uuid
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import or_, select
+
+from app.models import db, MidiaUpload, utcnow
+
+logger = logging.getLogger(__name__)
+
+_WORKERS = int(os.getenv("MIDIA_WORKERS", "2"))
+_MAX_TENTATIVAS = int(os.getenv("MIDIA_MAX_TENTATIVAS", "5"))
+_BACKOFF_BASE = float(os.getenv("MIDIA_BACKOFF_BASE_SEC", "20"))
+_BACKOFF_MAX = 1800.0
+_LEASE_SEC = 300
+_LOTE = 20
+_POLL_SEC = 5.0
+_LADO_MAX = int(os.getenv("MIDIA_LADO_MAX", "1600"))
+_LADO_MINIATURA = 320
+_QUALIDADE_WEBP = 80
+_BLOCO_B64 = 64 * 1024  # caracteres por bloco (múltiplo de 4)
+TAMANHO_MAXIMO_BYTES = 10 * 1024 * 1024
+
+# Colunas que o worker pode atualizar com a URL final
+_DESTINOS = {
+    ("registros_ponto", "foto_url"),
+    ("justificativas_ponto", "documento_url"),
+    ("motoristas", "cnh_documento_url"),
+    ("veiculos", "crlv_documento_url"),
+}
+
+_ARQUIVO_ID_SPOOL = ".spool_id"
+_ids_spool: Dict[str, str] = {}
+_acordar = threading.Event()
+_workers: List["MidiaWorker"] = []
+
+
+def backoff(tentativas: int) -> float:
+    return min(_BACKOFF_MAX, _BACKOFF_BASE * (2 ** max(0, tentativas - 1)))
+
+
+def _pasta_uploads() -> str:
+    return current_app.config.get("UPLOAD_FOLDER", "uploads")
+
+
+def _pasta_spool() -> str:
+    pasta = current_app.config.get("MIDIA_SPOOL_DIR") or os.path.join(_pasta_uploads(), ".spool")
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+def _id_spool() -> str:
+    """Identificador estável do spool (coluna host): gravado na própria pasta na
+    primeira vez, sobrevive a troca de hostname (container recriado com o mesmo
+    volume). Cada worker só pega os arquivos do spool que enxerga."""
+    pasta = _pasta_spool()
+    if pasta not in _ids_spool:
+        caminho = os.path.join(pasta, _ARQUIVO_ID_SPOOL)
+        if not os.path.exists(caminho):
+            temporario = f"{caminho}.{uuid.uuid4().hex}"
+            with open(temporario, "w") as f:
+                f.write(uuid.uuid4().hex)
+            try:
+                os.link(temporario, caminho)  # atômico: só um processo cria o id
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(temporario)
+        with open(caminho) as f:
+            _ids_spool[pasta] = f.read().strip()
+    return _ids_spool[pasta]
+
+
+def _decodificar_para_arquivo(data_url: str, inicio: int, destino: str) -> int:
+    """Decodifica o base64 de data_url[inicio:] em blocos, gravando direto no arquivo.
+
+    Nunca monta os bytes inteiros em memória (nem uma segunda cópia da string).
+    Retorna o tamanho decodificado; ValueError se inválido ou acima do limite."""
+    import binascii
+
+    total = 0
+    resto = ""
+    with open(destino, "wb") as f:
+        for pos in range(inicio, len(data_url), _BLOCO_B64):
+            bloco = resto + "".join(data_url[pos:pos + _BLOCO_B64].split())
+            corte = len(bloco) - len(bloco) % 4
+            try:
+                dados = binascii.a2b_base64(bloco[:corte], strict_mode=True)
+            except binascii.Error as e:
+                raise ValueError(f"Base64 inválido: {e}")
+            total += len(dados)
+            if total > TAMANHO_MAXIMO_BYTES:
+                raise ValueError("Arquivo muito grande. Tamanho máximo: 10MB.")
+            f.write(dados)
+            resto = bloco[corte:]
+    if resto:
+        raise ValueError("Base64 truncado")
+    return total
+
+
+def _otimizar(origem: str, content_type: Optional[str]) -> List[Tuple[str, str]]:
+    """Gera as versões a publicar: [(caminho, sufixo)]. Imagens viram WebP
+    reduzido + miniatura; o resto (PDF) segue como veio."""
+    if not (content_type or "").startswith("image/"):
+        return [(origem, "")]
+    from PIL import Image, ImageOps
+
+    base = os.path.splitext(origem)[0]
+    principal, miniatura = f"{base}.webp", f"{base}_mini.webp"
+    with Image.open(origem) as img:
+        img.draft("RGB", (_LADO_MAX, _LADO_MAX))  # JPEG: decodifica já reduzido
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+        img.thumbnail((_LADO_MAX, _LADO_MAX))
+        img.save(principal, "WEBP", quality=_QUALIDADE_WEBP, method=4)
+        img.thumbnail((_LADO_MINIATURA, _LADO_MINIATURA))
+        img.save(miniatura, "WEBP", quality=70, method=4)
+    return [(principal, ""), (miniatura, "_mini")]
+
+
+def _publicar(caminho: str, categoria: str, nome: str, nuvem: bool) -> str:
+    """Publica um arquivo do spool e devolve a URL definitiva."""
+    if nuvem and os.getenv("CLOUDINARY_URL"):
+        import cloudinary.uploader  # o SDK lê CLOUDINARY_URL do ambiente
+
+        result = cloudinary.uploader.upload(
+            caminho,  # caminho do arquivo: o SDK envia em stream, sem base64 em memória
+            folder=f"mercadinhosys/{categoria}",
+            public_id=nome,
+            resource_type="auto",
+        )
+        url = result.get("secure_url")
+        if not url:
+            raise RuntimeError("Cloudinary não retornou secure_url")
+        return url
+
+    pasta = os.path.join(_pasta_uploads(), categoria)
+    os.makedirs(pasta, exist_ok=True)
+    arquivo = nome + os.path.splitext(caminho)[1]
+    shutil.copyfile(caminho, os.path.join(pasta, arquivo))
+    return f"/uploads/{categoria}/{arquivo}"
+
+
+def _apagar(*caminhos: str) -> None:
+    for caminho in caminhos:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+class MidiaService:
+
+    @staticmethod
+    def ativa() -> bool:
+        """Há workers neste processo? Sem eles o processamento acontece em linha."""
+        return any(w.is_alive() for w in _workers)
+
+    @staticmethod
+    def _novo(categoria: str, prefixo: str, estabelecimento_id: Optional[int],
+              content_type: Optional[str], extensao: str) -> MidiaUpload:
+        handle = uuid.uuid4().hex
+        return MidiaUpload(
+            handle=handle, estabelecimento_id=estabelecimento_id, categoria=categoria,
+            nome=f"{prefixo}_{utcnow().strftime('%Y%m%d_%H%M%S')}_{handle[:8]}",
+            content_type=content_type, host=_id_spool(), status="spool",
+            caminho_spool=os.path.join(_pasta_spool(), f"{handle}.{extensao}"),
+            proxima_tentativa_em=utcnow(),
+        )
+
+    @staticmethod
+    def receber_base64(data_url: str, categoria: str, prefixo: str,
+                       estabelecimento_id: Optional[int] = None) -> MidiaUpload:
+        """Grava uma imagem data:image/...;base64 no spool. Não commita."""
+        if not data_url or not data_url.startswith("data:image"):
+            raise ValueError("Foto não é data URL de imagem válida")
+        virgula = data_url.find(",", 0, 200)
+        cabecalho = data_url[5:virgula] if virgula > 0 else ""
+        if not cabecalho.endswith(";base64"):
+            raise ValueError("Foto não está em base64")
+        content_type = cabecalho.split(";")[0]
+        midia = MidiaService._novo(categoria, prefixo, estabelecimento_id, content_type,
+                                   content_type.split("/")[-1] or "img")
+        try:
+            midia.tamanho = _decodificar_para_arquivo(data_url, virgula + 1, midia.caminho_spool)
+        except Exception:
+            _apagar(midia.caminho_spool)
+            raise
+        db.session.add(midia)
+        db.session.flush()
+        return midia
+
+    @staticmethod
+    def receber_arquivo(arquivo, categoria: str, prefixo: str,
+                        estabelecimento_id: Optional[int] = None) -> MidiaUpload:
+        """Grava um upload multipart (FileStorage) no spool, copiando em blocos. Não commita."""
+        nome = arquivo.filename or ""
+        extensao = nome.rsplit(".", 1)[-1].lower() if "." in nome else "bin"
+        midia = MidiaService._novo(categoria, prefixo, estabelecimento_id, arquivo.content_type, extensao)
+        arquivo.stream.seek(0)
+        arquivo.save(midia.caminho_spool)
+        midia.tamanho = os.path.getsize(midia.caminho_spool)
+        db.session.add(midia)
+        db.session.flush()
+        return midia
+
+    @staticmethod
+    def vincular(midia: MidiaUpload, registro, coluna: str) -> str:
+        """Aponta o registro para a URL provisória e agenda a troca pela final. Não commita."""
+        tabela = registro.__tablename__
+        if (tabela, coluna) not in _DESTINOS:
+            raise ValueError(f"Destino de mídia não permitido: {tabela}.{coluna}")
+        if registro.id is None:
+            db.session.flush()
+        midia.destino_tabela, midia.destino_id, midia.destino_coluna = tabela, registro.id, coluna
+        setattr(registro, coluna, midia.url_provisoria)
+        return midia.url_provisoria
+
+    @staticmethod
+    def despachar(*midias: MidiaUpload) -> None:
+        """Chamar após o commit: acorda os workers ou processa em linha."""
+        if MidiaService.ativa():
+            _acordar.set()
+        else:
+            MidiaService.processar_pendentes(ids=[m.id for m in midias])
+
+    @staticmethod
+    def _reivindicar(limite: int, ids: Optional[Iterable[int]] = None) -> List[int]:
+        """Lease num UPDATE só; cada host só pega o que está no próprio spool."""
+        t = MidiaUpload.__table__
+        agora = utcnow()
+        vencidos = (t.c.status == "spool", t.c.host == _id_spool(),
+                    or_(t.c.proxima_tentativa_em.is_(None), t.c.proxima_tentativa_em <= agora))
+        if ids is None:
+            ids = db.session.execute(
+                select(t.c.id).where(*vencidos).order_by(t.c.proxima_tentativa_em, t.c.id).limit(limite)
+            ).scalars().all()
+        ids = list(ids)
+        if not ids:
+            return []
+        reivindicados = db.session.execute(
+            t.update().where(t.c.id.in_(ids), *vencidos)
+            .values(proxima_tentativa_em=agora + timedelta(seconds=_LEASE_SEC), tentativas=t.c.tentativas + 1)
+            .returning(t.c.id)
+        ).scalars().all()
+        db.session.commit()
+        return sorted(reivindicados)
+
+    @staticmethod
+    def adotar_orfaos() -> int:
+        """Traz para este spool os uploads pendentes de outro host cujo arquivo está
+        aqui (registros antigos, gravados com o hostname). Chamado no boot dos workers."""
+        t = MidiaUpload.__table__
+        meu = _id_spool()
+        orfaos = [
+            i for i, caminho in db.session.execute(
+                select(t.c.id, t.c.caminho_spool).where(t.c.status == "spool", or_(t.c.host.is_(None), t.c.host != meu))
+            ).all()
+            if caminho and os.path.exists(caminho)
+        ]
+        if orfaos:
+            db.session.execute(t.update().where(t.c.id.in_(orfaos), t.c.status == "spool").values(host=meu))
+        db.session.commit()
+        return len(orfaos)
+
+    @staticmethod
+    def processar_pendentes(limite: int = _LOTE, ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+        """Otimiza e publica um lote do spool. Retorna contagem por status."""
+        contagem: Dict[str, int] = {}
+        for midia_id in MidiaService._reivindicar(limite, ids):
+            status = MidiaService._processar_um(midia_id)
+            contagem[status] = contagem.get(status, 0) + 1
+        return contagem
+
+    @staticmethod
+    def _processar_um(midia_id: int) -> str:
+        t = MidiaUpload.__table__
+        m = db.session.execute(select(t).where(t.c.id == midia_id)).mappings().one()
+        ultima = m["tentativas"] >= _MAX_TENTATIVAS
+        gerados: List[str] = []
+        try:
+            try:
+                versoes = _otimizar(m["caminho_spool"], m["content_type"])
+            except Exception as e:
+                # Imagem que o Pillow não abre: publica o original mesmo
+                logger.warning(f"[MÍDIA] {m['handle']}: otimização falhou ({e}); publicando original")
+                versoes = [(m["caminho_spool"], "")]
+            gerados = [c for c, _ in versoes if c != m["caminho_spool"]]
+            # Na última tentativa desiste da nuvem e grava no disco local
+            urls = [_publicar(c, m["categoria"], m["nome"] + sufixo, nuvem=not ultima) for c, sufixo in versoes]
+        except Exception as e:
+            _apagar(*gerados)
+            definitivo = ultima
+            db.session.execute(t.update().where(t.c.id == midia_id).values(
+                status="falhou" if definitivo else "spool", ultimo_erro=str(e)[:1000],
+                proxima_tentativa_em=None if definitivo else utcnow() + timedelta(seconds=backoff(m["tentativas"])),
+            ))
+            db.session.commit()
+            logger.error(f"[MÍDIA] {m['handle']} (tentativa {m['tentativas']}): {e}")
+            return "falhou" if definitivo else "spool"
+
+        db.session.execute(t.update().where(t.c.id == midia_id).values(
+            status="pronto", url=urls[0], url_miniatura=urls[1] if len(urls) > 1 else None,
+            ultimo_erro=None, proxima_tentativa_em=None, concluido_em=utcnow(),
+        ))
+        if (m["destino_tabela"], m["destino_coluna"]) in _DESTINOS and m["destino_id"]:
+            destino = db.metadata.tables[m["destino_tabela"]]
+            coluna = destino.c[m["destino_coluna"]]
+            provisoria = f"/uploads/midia/{m['handle']}"
+            db.session.execute(
+                destino.update().where(destino.c.id == m["destino_id"], coluna == provisoria)
+                .values({coluna.name: urls[0]})
+            )
+        db.session.commit()
+        _apagar(m["caminho_spool"], *gerados)
+        return "pronto"
+
+    @staticmethod
+    def localizar(handle: str) -> Optional[Dict[str, Any]]:
+        t = MidiaUpload.__table__
+        linha = db.session.execute(
+            select(t.c.status, t.c.url, t.c.caminho_spool, t.c.content_type).where(t.c.handle == handle)
+        ).mappings().first()
+        return dict(linha) if linha else None
+
+
+class MidiaWorker(threading.Thread):
+    def __init__(self, app, indice: int):
+        super().__init__(name=f"midia-{indice}")
+        self.app = app
+        self.daemon = True
+
+    def run(self):
+        while True:
+            _acordar.wait(timeout=_POLL_SEC)
+            _acordar.clear()
+            try:
+                with self.app.app_context():
+                    while MidiaService.processar_pendentes():
+                        pass
+            except Exception as e:
+                self.app.logger.error(f"[MÍDIA] Erro no ciclo do pipeline: {e}")
+
+
+def start_midia_pipeline(app):
+    """Inicia os workers do pipeline de mídia. Retorna a lista de threads (vazia se desabilitado)."""
+    if app.config.get("TESTING") or _WORKERS <= 0:
+        app.logger.info("[MÍDIA] Workers NÃO iniciados (desabilitado); mídia processada em linha.")
+        return []
+    if not _workers:
+        with app.app_context():
+            adotados = MidiaService.adotar_orfaos()
+        if adotados:
+            app.logger.info(f"[MÍDIA] {adotados} upload(s) pendente(s) de outro host adotado(s) por este spool.")
+        for i in range(_WORKERS):
+            worker = MidiaWorker(app, i)
+            worker.start()
+            _workers.append(worker)
+        app.logger.info(f"[MÍDIA] {_WORKERS} worker(s) do pipeline de mídia iniciado(s).")
+    return list(_workers)
@@ -0,0 +1,266 @@
+"""
+Particionamento mensal por faixa (RANGE) de vendas, venda_itens, pagamentos e
+movimentacoes_estoque no Postgres.
+
+Opcional e explícito (`flask particionar-tabelas`): a tabela é renomeada para
+``<tabela>_legado``, recriada como ``PARTITION BY RANGE`` na chave do modelo
+(``__chave_particao__``: data_venda nas vendas, created_at nas demais), recebe
+uma partição por mês (``<tabela>_pAAAAMM``) mais a partição padrão
+(``<tabela>_padrao``) e os dados são copiados. Restrições do Postgres que a
+conversão assume:
+
+- PK e UNIQUE passam a incluir a chave de partição (``(id, data_venda)``):
+  código/sync_uuid deixam de ser únicos na tabela toda e só continuam únicos
+  pelos geradores da app (as restrições enfraquecidas voltam no resumo, em
+  ``unicos_com_chave``). Quem faz upsert na tabela precisa usar a PK inteira
+  no ON CONFLICT (scripts de sync e restauro de backup leem a PK do destino);
+- FKs que APONTAM para a tabela convertida (ex.: venda_itens.venda_id →
+  vendas.id) não são possíveis sem a chave e são removidas (retornadas no
+  resumo, em ``fks_removidas``); as FKs que SAEM dela são recriadas.
+
+Depois disso, a manutenção (`manter`) cria as partições dos próximos meses e
+`arquivar` desanexa meses frios para outro schema (DETACH + SET SCHEMA), fora
+das consultas do dia a dia. As consultas do sistema levam predicados na chave
+de partição (app.models.janela_particionada) para o planner podar partições.
+
+Em SQLite (testes/offline) não existe particionamento nativo: todas as
+operações aqui são no-op e os predicados de janela só usam os índices.
+"""
+import logging
+import os
+import re
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.models import db, MovimentacaoEstoque, Pagamento, Venda, VendaItem
+
+logger = logging.getLogger(__name__)
+
+MESES_A_FRENTE = int(os.getenv("PARTICOES_MESES_A_FRENTE", "3"))
+ESQUEMA_ARQUIVO = os.getenv("PARTICOES_ESQUEMA_ARQUIVO", "arquivo")
+
+# Ordem importa: vendas primeiro, para as FKs dos filhos já saírem na conversão dela.
+MODELOS_PARTICIONADOS = (Venda, VendaItem, Pagamento, MovimentacaoEstoque)
+
+_RE_PARTICAO = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def meses(desde: date, ate: date) -> List[date]:
+    """Primeiros dias dos meses de ``desde`` até ``ate`` (inclusive)."""
+    atual, fim = date(desde.year, desde.month, 1), date(ate.year, ate.month, 1)
+    resultado = []
+    while atual <= fim:
+        resultado.append(atual)
+        atual = proximo_mes(atual)
+    return resultado
+
+
+def proximo_mes(mes: date) -> date:
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def somar_meses(mes: date, n: int) -> date:
+    indice = mes.year * 12 + mes.month - 1 + n
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def nome_particao(tabela: str, mes: date) -> str:
+    return f"{tabela}_p{mes:%Y%m}"
+
+
+def ddl_particao(tabela: str, mes: date) -> str:
+    return (f"CREATE TABLE IF NOT EXISTS {nome_particao(tabela, mes)} PARTITION OF {tabela} "
+            f"FOR VALUES FROM ('{mes:%Y-%m-%d}') TO ('{proximo_mes(mes):%Y-%m-%d}')")
+
+
+def com_chave(definicao: str, chave: str) -> str:
+    """Acrescenta a chave de partição à lista de colunas de um UNIQUE/índice único."""
+    return re.sub(r"\)(\s+WHERE\s.*)?$", lambda m: f", {chave}){m.group(1) or ''}", definicao.strip(), count=1)
+
+
+def _renomeado(nome: str) -> str:
+    return f"{nome[:56]}_legado"  # identificadores do Postgres têm até 63 caracteres
+
+
+class ParticionamentoService:
+    """Conversão, manutenção e arquivamento das partições mensais."""
+
+    @staticmethod
+    def tabelas() -> Dict[str, str]:
+        """{tabela: coluna da chave de partição}."""
+        return {m.__tablename__: m.__chave_particao__ for m in MODELOS_PARTICIONADOS}
+
+    @staticmethod
+    def suportado() -> bool:
+        return db.session.get_bind().dialect.name == "postgresql"
+
+    @staticmethod
+    def particionadas() -> List[str]:
+        if not ParticionamentoService.suportado():
+            return []
+        nomes = db.session.execute(text(
+            "SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relnamespace = current_schema()::regnamespace"
+        )).scalars().all()
+        return [t for t in ParticionamentoService.tabelas() if t in set(nomes)]
+
+    @staticmethod
+    def listar(tabela: str) -> List[Dict]:
+        """Partições anexadas de ``tabela`` com os limites e linhas estimadas."""
+        if tabela not in ParticionamentoService.particionadas():
+            return []
+        linhas = db.session.execute(text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:t AS regclass) ORDER BY c.relname"
+        ), {"t": tabela}).all()
+        return [{"nome": nome, "limites": limites, "linhas_estimadas": max(int(n or 0), 0)}
+                for nome, limites, n in linhas]
+
+    @staticmethod
+    def criar_particoes(tabela: str, ate: date, desde: Optional[date] = None) -> Dict:
+        """Cria (se faltarem) as partições mensais de ``desde`` (mês atual) a ``ate``.
+
+        Cada mês roda num savepoint: se a partição padrão já tiver linhas do
+        mês, o Postgres recusa a criação e o mês é reportado em ``falhas``.
+        """
+        desde = desde or date.today()
+        existentes = {p["nome"] for p in ParticionamentoService.listar(tabela)}
+        criadas, falhas = [], []
+        for mes in meses(desde, ate):
+            nome = nome_particao(tabela, mes)
+            if nome in existentes:
+                continue
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(text(ddl_particao(tabela, mes)))
+                criadas.append(nome)
+            except Exception as e:
+                logger.warning(f"[PARTIÇÕES] {nome} não criada: {e}")
+                falhas.append(nome)
+        return {"criadas": criadas, "falhas": falhas}
+
+    @staticmethod
+    def manter(meses_a_frente: int = None) -> Dict[str, Dict]:
+        """Garante as partições do mês atual até ``meses_a_frente`` meses adiante."""
+        meses_a_frente = MESES_A_FRENTE if meses_a_frente is None else meses_a_frente
+        hoje = date.today()
+        resumo = {}
+        for tabela in ParticionamentoService.particionadas():
+            resumo[tabela] = ParticionamentoService.criar_particoes(tabela, somar_meses(hoje, meses_a_frente), hoje)
+        db.session.commit()
+        return resumo
+
+    @staticmethod
+    def arquivar(tabela: str, antes_de: date, esquema: str = None) -> List[str]:
+        """Desanexa as partições de meses anteriores a ``antes_de`` e as move
+        para ``esquema``: os dados ficam consultáveis lá, fora da tabela quente."""
+        esquema = esquema or ESQUEMA_ARQUIVO
+        limite = date(antes_de.year, antes_de.month, 1)
+        frias = []
+        for particao in ParticionamentoService.listar(tabela):
+            m = _RE_PARTICAO.search(particao["nome"])
+            if m and date(int(m.group(1)), int(m.group(2)), 1) < limite:
+                frias.append(particao["nome"])
+        if not frias:
+            return []
+        db.session.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{esquema}"'))
+        for nome in frias:
+            db.session.execute(text(f"ALTER TABLE {tabela} DETACH PARTITION {nome}"))
+            db.session.execute(text(f'ALTER TABLE {nome} SET SCHEMA "{esquema}"'))
+        db.session.commit()
+        logger.info(f"[PARTIÇÕES] {len(frias)} partição(ões) de {tabela} arquivada(s) em {esquema}")
+        return frias
+
+    @staticmethod
+    def converter(tabela: str, meses_a_frente: int = None, manter_legado: bool = False) -> Dict:
+        """Converte ``tabela`` (comum) em particionada por mês, numa transação."""
+        chaves = ParticionamentoService.tabelas()
+        if tabela not in chaves:
+            raise ValueError(f"Tabela sem chave de partição: {tabela}")
+        if not ParticionamentoService.suportado():
+            return {"tabela": tabela, "convertida": False, "motivo": "particionamento nativo exige Postgres"}
+        if tabela in ParticionamentoService.particionadas():
+            return {"tabela": tabela, "convertida": False, "motivo": "já particionada"}
+
+        chave = chaves[tabela]
+        legado = f"{tabela}_legado"
+        meses_a_frente = MESES_A_FRENTE if meses_a_frente is None else meses_a_frente
+        exe = lambda sql, **p: db.session.execute(text(sql), p)
+
+        dependentes = exe(
+            "SELECT DISTINCT v.relname FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid "
+            "JOIN pg_class v ON v.oid = r.ev_class WHERE d.refobjid = CAST(:t AS regclass) AND v.relname <> :t",
+            t=tabela).scalars().all()
+        if dependentes:
+            raise ValueError(f"Views dependem de {tabela}: {', '.join(dependentes)}")
+
+        # Postgres só referencia chave com a coluna de partição: FKs de entrada saem
+        fks_entrada = exe(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = CAST(:t AS regclass)", t=tabela).all()
+        for origem, nome in fks_entrada:
+            exe(f'ALTER TABLE {origem} DROP CONSTRAINT "{nome}"')
+
+        restricoes = exe(
+            "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = CAST(:t AS regclass) AND contype IN ('p', 'u', 'f')", t=tabela).all()
+        indices = exe(
+            "SELECT i.relname, ix.indisunique, pg_get_indexdef(ix.indexrelid) FROM pg_index ix "
+            "JOIN pg_class i ON i.oid = ix.indexrelid WHERE ix.indrelid = CAST(:t AS regclass) "
+            "AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = ix.indexrelid "
+            "AND c.conrelid = ix.indrelid AND c.contype IN ('p', 'u'))", t=tabela).all()
+
+        # Nomes de índice são globais no schema: o legado libera os originais
+        exe(f"ALTER TABLE {tabela} RENAME TO {legado}")
+        for nome, tipo, _ in restricoes:
+            if tipo in ("p", "u"):
+                exe(f'ALTER TABLE {legado} RENAME CONSTRAINT "{nome}" TO "{_renomeado(nome)}"')
+        for nome, _, _ in indices:
+            exe(f'ALTER INDEX "{nome}" RENAME TO "{_renomeado(nome)}"')
+
+        exe(f"UPDATE {legado} SET {chave} = COALESCE(updated_at, now()) WHERE {chave} IS NULL")
+        exe(f"CREATE TABLE {tabela} (LIKE {legado} INCLUDING DEFAULTS INCLUDING GENERATED) "
+            f"PARTITION BY RANGE ({chave})")
+        exe(f"ALTER TABLE {tabela} ALTER COLUMN {chave} SET NOT NULL")
+        for nome, tipo, definicao in restricoes:
+            if tipo == "p":
+                exe(f'ALTER TABLE {tabela} ADD CONSTRAINT "{nome}" PRIMARY KEY (id, {chave})')
+            elif tipo == "u":
+                exe(f'ALTER TABLE {tabela} ADD CONSTRAINT "{nome}" {com_chave(definicao, chave)}')
+        for _, unico, definicao in indices:
+            exe(com_chave(definicao, chave) if unico else definicao)
+
+        menor, maior = exe(f"SELECT MIN({chave}), MAX({chave}) FROM {legado}").one()
+        hoje = date.today()
+        inicio = (menor.date() if isinstance(menor, datetime) else menor) or hoje
+        fim = max(somar_meses(hoje, meses_a_frente), (maior.date() if isinstance(maior, datetime) else maior) or hoje)
+        for mes in meses(inicio, fim):
+            exe(ddl_particao(tabela, mes))
+        exe(f"CREATE TABLE IF NOT EXISTS {tabela}_padrao PARTITION OF {tabela} DEFAULT")
+
+        copiadas = exe(f"INSERT INTO {tabela} SELECT * FROM {legado}").rowcount
+        sequencia = exe("SELECT pg_get_serial_sequence(:t, 'id')", t=legado).scalar()
+        if sequencia:
+            exe(f"ALTER SEQUENCE {sequencia} OWNED BY {tabela}.id")
+        for nome, tipo, definicao in restricoes:
+            if tipo == "f":
+                exe(f'ALTER TABLE {tabela} ADD CONSTRAINT "{nome}" {definicao}')
+        if not manter_legado:
+            exe(f"DROP TABLE {legado}")
+        db.session.commit()
+
+        resumo = {
+            "tabela": tabela, "convertida": True, "chave": chave, "linhas": copiadas,
+            "particoes": len(meses(inicio, fim)), "fks_removidas": [f"{o}.{n}" for o, n in fks_entrada],
+            "unicos_com_chave": [nome for nome, tipo, _ in restricoes if tipo == "u"]
+                                + [nome for nome, unico, _ in indices if unico],
+            "legado": legado if manter_legado else None,
+        }
+        logger.info(f"[PARTIÇÕES] {tabela} particionada por {chave}: {resumo}")
+        if resumo["fks_removidas"] or resumo["unicos_com_chave"]:
+            logger.warning(f"[PARTIÇÕES] {tabela}: FKs removidas {resumo['fks_removidas']}; "
+                           f"unicidade agora por {chave} em {resumo['unicos_com_chave']}")
+        return resumo
@@ -0,0 +1,194 @@
+"""
+Autorização por PIN de segurança (estorno de venda, sangria, gates de edição).
+
+O PIN tem só 4 a 6 dígitos, então o hash lento (werkzeug) é o que protege o
+banco contra força bruta offline, e o custo dele é o que pesa na autorização: o
+fluxo antigo carregava todos os admins/gerentes do tenant e testava o hash de
+cada um até acertar (N verificações de ~50 ms por tentativa).
+
+Aqui cada Funcionario guarda, ao lado do hash, uma chave de busca
+``pin_busca = versão$HMAC-SHA256(pepper, "estab:pin")``. O pepper fica fora do
+banco (PIN_PEPPER, com fallback para SECRET_KEY), então um dump sozinho não
+permite testar os 10^6 PINs contra a chave. A autorização vira uma consulta
+pelo índice (estabelecimento_id, pin_busca) seguida de exatamente um hash lento
+no candidato encontrado.
+
+Migração: PINs gravados antes desta coluna (ou com a chave de um pepper
+anterior — a versão é a impressão digital do pepper) não casam pelo índice.
+Quando a busca indexada falha, só esses registros pendentes passam pelo
+caminho antigo; quem acertar recebe a chave nova e nunca mais cai nele.
+
+Tentativas erradas são contadas por origem no cache da aplicação: o operador
+autenticado (identidade do JWT) dentro do tenant, acrescido do caixa apenas
+quando ele é do tenant e está aberto — o cabeçalho X-Caixa-Id sozinho não abre
+contagem nova. O contador é incrementado atomicamente (INCR no Redis); passado
+o limite na janela a origem fica bloqueada e as rotas respondem 429 com
+Retry-After.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import time
+
+from flask import current_app, has_request_context, request
+from sqlalchemy import or_
+
+from app import cache
+from app.models import db, Funcionario
+
+logger = logging.getLogger(__name__)
+
+_NIVEL_AUTORIZADOR = 2  # 1=Admin, 2=Gerente
+
+
+class PinBloqueado(Exception):
+    """Origem excedeu as tentativas de PIN da janela; ``retry_after`` em segundos."""
+
+    def __init__(self, retry_after):
+        super().__init__("Muitas tentativas de PIN. Aguarde para tentar novamente.")
+        self.retry_after = int(retry_after)
+
+
+def _pepper() -> bytes:
+    pepper = current_app.config.get("PIN_PEPPER") or current_app.config.get("SECRET_KEY") or ""
+    return pepper.encode()
+
+
+def _versao(pepper: bytes) -> str:
+    return hashlib.sha256(pepper).hexdigest()[:8]
+
+
+def chave_busca(estabelecimento_id, pin) -> str:
+    """Chave indexável do PIN no tenant: ``versão$hmac``. Determinística para o mesmo pepper."""
+    pepper = _pepper()
+    digest = hmac.new(pepper, f"{estabelecimento_id}:{str(pin).strip()}".encode(), hashlib.sha256).hexdigest()
+    return f"{_versao(pepper)}${digest}"
+
+
+def _caixa_aberto(estabelecimento_id, caixa_id):
+    """O caixa só entra na origem se for do tenant e estiver aberto."""
+    from app.models import Caixa
+    try:
+        caixa_id = int(caixa_id)
+    except (TypeError, ValueError):
+        return None
+    existe = db.session.query(Caixa.id).filter(
+        Caixa.id == caixa_id,
+        Caixa.estabelecimento_id == estabelecimento_id,
+        Caixa.status == "aberto",
+    ).first()
+    return caixa_id if existe else None
+
+
+def origem_da_requisicao(estabelecimento_id, caixa_id=None) -> str:
+    """
+    Unidade de contagem das tentativas: o operador do JWT (ou o IP, sem JWT),
+    mais o caixa (argumento ou X-Caixa-Id) quando ele é do tenant e está aberto.
+    """
+    if not has_request_context():
+        return "-"
+    from flask_jwt_extended import get_jwt_identity
+    try:
+        identidade = get_jwt_identity()
+    except Exception:
+        identidade = None
+    origem = f"funcionario:{identidade}" if identidade else f"ip:{request.remote_addr}"
+    caixa = _caixa_aberto(estabelecimento_id, caixa_id or request.headers.get("X-Caixa-Id", "").strip())
+    return f"{origem}:caixa:{caixa}" if caixa else origem
+
+
+class PinService:
+    @staticmethod
+    def _limites():
+        return (int(os.environ.get("PIN_MAX_TENTATIVAS", 5)),
+                int(os.environ.get("PIN_JANELA_SEC", 300)))
+
+    @staticmethod
+    def _chave_falhas(estabelecimento_id, origem):
+        return f"pin:falhas:{estabelecimento_id}:{origem or '-'}"
+
+    @staticmethod
+    def _verificar_bloqueio(estabelecimento_id, origem):
+        chave = PinService._chave_falhas(estabelecimento_id, origem)
+        ate = cache.get(f"{chave}:ate")
+        if ate:
+            restante = ate - time.time()
+            if restante > 0:
+                raise PinBloqueado(restante)
+
+    @staticmethod
+    def _registrar_falha(estabelecimento_id, origem):
+        maximo, janela = PinService._limites()
+        chave = PinService._chave_falhas(estabelecimento_id, origem)
+        # add só cria (SET NX) e fixa a janela; inc é atômico, sem ler-e-gravar
+        cache.add(chave, 0, timeout=janela)
+        falhas = cache.cache.inc(chave) or 0
+        if falhas >= maximo:
+            cache.add(f"{chave}:ate", time.time() + janela, timeout=janela)
+            logger.warning("PIN bloqueado para %s no estabelecimento %s após %s falhas",
+                           origem, estabelecimento_id, falhas)
+
+    @staticmethod
+    def _zerar_falhas(estabelecimento_id, origem):
+        chave = PinService._chave_falhas(estabelecimento_id, origem)
+        cache.delete_many(chave, f"{chave}:ate")
+
+    @staticmethod
+    def _candidatos():
+        return Funcionario.query.filter(
+            Funcionario.pin_cancelamento.isnot(None),
+            Funcionario.nivel_acesso <= _NIVEL_AUTORIZADOR,
+            Funcionario.ativo.isnot(False),
+        )
+
+    @staticmethod
+    def autorizar(estabelecimento_id, pin, origem=None):
+        """
+        Retorna o admin/gerente do tenant dono do PIN, ou None.
+        Levanta PinBloqueado se a origem estiver bloqueada (antes de qualquer hash).
+        """
+        pin = str(pin or "").strip()
+        if not pin or not estabelecimento_id:
+            return None
+        PinService._verificar_bloqueio(estabelecimento_id, origem)
+
+        chave = chave_busca(estabelecimento_id, pin)
+        base = PinService._candidatos().filter(Funcionario.estabelecimento_id == estabelecimento_id)
+        # Em regra um único candidato; colisão só se dois gerentes escolherem o mesmo PIN
+        autorizador = next((f for f in base.filter(Funcionario.pin_busca == chave).all() if f.check_pin(pin)), None)
+
+        if autorizador is None:
+            autorizador = PinService._migrar(base, chave, pin)
+
+        if autorizador is None:
+            PinService._registrar_falha(estabelecimento_id, origem)
+            return None
+        PinService._zerar_falhas(estabelecimento_id, origem)
+        return autorizador
+
+    @staticmethod
+    def _migrar(base, chave, pin):
+        """Caminho antigo, restrito aos PINs sem chave da versão atual; grava a chave de quem acertar."""
+        versao = chave.split("$", 1)[0]
+        pendentes = base.filter(or_(
+            Funcionario.pin_busca.is_(None),
+            ~Funcionario.pin_busca.startswith(f"{versao}$", autoescape=True),
+        )).all()
+        autorizador = next((f for f in pendentes if f.check_pin(pin)), None)
+        if autorizador is not None:
+            autorizador.pin_busca = chave
+            db.session.commit()
+        return autorizador
+
+    @staticmethod
+    def pendentes_migracao(estabelecimento_id=None) -> int:
+        """Quantos autorizadores ainda dependem do caminho antigo (sem chave da versão atual)."""
+        versao = chave_busca(0, "").split("$", 1)[0]
+        consulta = PinService._candidatos().filter(or_(
+            Funcionario.pin_busca.is_(None),
+            ~Funcionario.pin_busca.startswith(f"{versao}$", autoescape=True),
+        ))
+        if estabelecimento_id:
+            consulta = consulta.filter(Funcionario.estabelecimento_id == estabelecimento_id)
+        return consulta.count()
@@ -0,0 +1,275 @@
+"""
+Consolidado diário do ponto (tabela ponto_diario / PontoDiario).
+
+Cada batida (RegistroPonto) registrada, ajustada ou excluída recalcula a linha
+do dia daquele funcionário — no máximo quatro batidas, com a MESMA regra do
+espelho (rh_calculator_service): primeira entrada, última saída, intervalo,
+minutos trabalhados descontando o almoço, atraso e hora extra além da jornada
+diária (CLT). Estatísticas do ponto, relatórios, espelho, folha e o dashboard
+de RH agrupam esta tabela (SUM/COUNT por funcionário ou por dia) em vez de
+carregar todas as batidas do período para o Python — um relatório mensal custa
+o mesmo para 5 ou 500 funcionários.
+
+Faltas não viram linha: são os dias úteis do período sem ``presente`` e saem
+da conta no agrupamento. Troca de jornada na ConfiguracaoHorario reaplica a
+hora extra com um UPDATE único (reaplicar_jornada); o histórico anterior à
+tabela é consolidado no upgrade da migração, e ``flask reconstruir-ponto-diario``
+o refaz sob demanda.
+"""
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import case, delete, func, or_, update
+
+from app.models import db, ConfiguracaoHorario, PontoDiario, RegistroPonto, allow_all_tenants, utcnow
+from app.services.banco_horas_service import BancoHorasService
+from app.services.rh_calculator_service import JORNADA_PADRAO_MIN
+
+logger = logging.getLogger(__name__)
+
+_TIPOS_COM_ATRASO = ("entrada", "saida_almoco", "retorno_almoco")
+
+
+def _minutos(t) -> int:
+    return t.hour * 60 + t.minute
+
+
+def consolidar(registros: Iterable, jornada_min: int = JORNADA_PADRAO_MIN) -> dict:
+    """Colunas do PontoDiario a partir das batidas de UM funcionário em UM dia.
+
+    Minutos contados em HH:MM (segundos descartados), como no espelho; hora
+    extra só existe com entrada e saída no dia.
+    """
+    entrada = saida = ii = iff = None
+    atraso = atraso_entrada = batidas = atrasadas = 0
+    entrada_atrasada = False
+    observacao = None
+    for r in registros:
+        batidas += 1
+        if r.status == "atrasado":
+            atrasadas += 1
+        if r.tipo_registro in _TIPOS_COM_ATRASO:
+            atraso += r.minutos_atraso or 0
+        if r.tipo_registro == "entrada":
+            if entrada is None or r.hora < entrada:
+                entrada = r.hora
+            atraso_entrada += r.minutos_atraso or 0
+            entrada_atrasada = entrada_atrasada or r.status == "atrasado"
+        elif r.tipo_registro == "saida_almoco":
+            ii = r.hora
+        elif r.tipo_registro == "retorno_almoco":
+            iff = r.hora
+        elif r.tipo_registro == "saida":
+            if saida is None or r.hora > saida:
+                saida = r.hora
+        if r.observacao:
+            observacao = r.observacao
+
+    trabalhados = extras = 0
+    if entrada and saida:
+        trabalhados = _minutos(saida) - _minutos(entrada)
+        if ii and iff:
+            trabalhados -= _minutos(iff) - _minutos(ii)
+        trabalhados = max(0, trabalhados)
+        extras = max(0, trabalhados - jornada_min)
+
+    return {
+        "primeira_entrada": entrada, "inicio_intervalo": ii, "fim_intervalo": iff, "ultima_saida": saida,
+        "presente": entrada is not None, "batidas": batidas, "batidas_atrasadas": atrasadas,
+        "minutos_trabalhados": trabalhados, "minutos_atraso": atraso, "minutos_atraso_entrada": atraso_entrada,
+        "entrada_atrasada": entrada_atrasada, "minutos_extras": extras, "observacao": observacao,
+    }
+
+
+def dias_uteis(inicio: date, fim: date, trabalha_sabado: bool = False) -> int:
+    """Dias úteis do período (seg–sex, ou seg–sáb) sem laço dia a dia."""
+    if fim < inicio:
+        return 0
+    por_semana = 6 if trabalha_sabado else 5
+    total = (fim - inicio).days + 1
+    semanas, resto = divmod(total, 7)
+    uteis = semanas * por_semana
+    dia = inicio.weekday()
+    for i in range(resto):
+        if (dia + i) % 7 < por_semana:
+            uteis += 1
+    return uteis
+
+
+class PontoDiarioService:
+    @staticmethod
+    def jornada(estabelecimento_id) -> int:
+        config = ConfiguracaoHorario.query.filter_by(estabelecimento_id=estabelecimento_id).first()
+        return (config.jornada_diaria_minutos if config and config.jornada_diaria_minutos
+                else JORNADA_PADRAO_MIN)
+
+    @staticmethod
+    def recalcular_dia(funcionario_id, estabelecimento_id, dia, jornada_min=None) -> Optional[PontoDiario]:
+        """Reconsolida o dia do funcionário na sessão atual (quem chama faz o commit).
+
+        Sem batidas restantes a linha do dia é removida. O banco de horas do dia
+        é lançado junto (banco_horas_service).
+        """
+        registros = (RegistroPonto.query
+                     .filter_by(funcionario_id=funcionario_id, data=dia)
+                     .order_by(RegistroPonto.hora)
+                     .all())
+        linha = PontoDiario.query.filter_by(funcionario_id=funcionario_id, data=dia).first()
+        if jornada_min is None:
+            jornada_min = PontoDiarioService.jornada(estabelecimento_id)
+        if not registros:
+            if linha:
+                db.session.delete(linha)
+            BancoHorasService.lancar_dia(funcionario_id, estabelecimento_id, dia, None, jornada_min)
+            return None
+        if linha is None:
+            linha = PontoDiario(funcionario_id=funcionario_id, estabelecimento_id=estabelecimento_id, data=dia)
+            db.session.add(linha)
+        for campo, valor in consolidar(registros, jornada_min).items():
+            setattr(linha, campo, valor)
+        BancoHorasService.lancar_dia(funcionario_id, estabelecimento_id, dia, linha, jornada_min)
+        return linha
+
+    @staticmethod
+    def reaplicar_jornada(estabelecimento_id, jornada_min) -> int:
+        """Nova jornada diária: recalcula a hora extra de todo o histórico da loja em um UPDATE."""
+        com_saida = PontoDiario.primeira_entrada.isnot(None) & PontoDiario.ultima_saida.isnot(None)
+        resultado = db.session.execute(
+            update(PontoDiario)
+            .where(PontoDiario.estabelecimento_id == estabelecimento_id)
+            .values(minutos_extras=case(
+                (com_saida & (PontoDiario.minutos_trabalhados > jornada_min),
+                 PontoDiario.minutos_trabalhados - jornada_min),
+                else_=0,
+            ))
+            .execution_options(synchronize_session=False)
+        )
+        return resultado.rowcount or 0
+
+    @staticmethod
+    def reconstruir(estabelecimento_id=None, data_inicio=None, data_fim=None, lote=5000) -> int:
+        """Refaz o consolidado a partir das batidas (migração do histórico / reparo).
+
+        Uma leitura ordenada das batidas em streaming, linhas gravadas em lote.
+        """
+        with allow_all_tenants():
+            filtros = []
+            if estabelecimento_id:
+                filtros.append(RegistroPonto.estabelecimento_id == estabelecimento_id)
+            if data_inicio:
+                filtros.append(RegistroPonto.data >= data_inicio)
+            if data_fim:
+                filtros.append(RegistroPonto.data <= data_fim)
+
+            apagar = delete(PontoDiario)
+            if estabelecimento_id:
+                apagar = apagar.where(PontoDiario.estabelecimento_id == estabelecimento_id)
+            if data_inicio:
+                apagar = apagar.where(PontoDiario.data >= data_inicio)
+            if data_fim:
+                apagar = apagar.where(PontoDiario.data <= data_fim)
+            db.session.execute(apagar)
+
+            jornadas = defaultdict(lambda: JORNADA_PADRAO_MIN)
+            for estab_id, jornada in db.session.query(ConfiguracaoHorario.estabelecimento_id,
+                                                      ConfiguracaoHorario.jornada_diaria_minutos):
+                if jornada:
+                    jornadas[estab_id] = jornada
+
+            registros = (db.session.query(RegistroPonto).filter(*filtros)
+                         .order_by(RegistroPonto.funcionario_id, RegistroPonto.data, RegistroPonto.hora)
+                         .yield_per(lote))
+            linhas, chave_atual, dia_atual, total = [], None, [], 0
+
+            def _fechar():
+                fid, estab_id, dia = chave_atual
+                linhas.append({"funcionario_id": fid, "estabelecimento_id": estab_id, "data": dia,
+                               "atualizado_em": utcnow(), **consolidar(dia_atual, jornadas[estab_id])})
+
+            for r in registros:
+                chave = (r.funcionario_id, r.estabelecimento_id, r.data)
+                if chave != chave_atual and dia_atual:
+                    _fechar()
+                    dia_atual = []
+                    if len(linhas) >= lote:
+                        db.session.execute(PontoDiario.__table__.insert(), linhas)
+                        total += len(linhas)
+                        linhas = []
+                chave_atual = chave
+                dia_atual.append(r)
+            if dia_atual:
+                _fechar()
+            if linhas:
+                db.session.execute(PontoDiario.__table__.insert(), linhas)
+                total += len(linhas)
+            db.session.commit()
+            return total
+
+    # ------------------------------------------------------------------
+    # Leituras agrupadas
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _somas():
+        pd = PontoDiario
+        return (
+            func.count(pd.id).label("dias"),
+            func.sum(case((pd.presente, 1), else_=0)).label("dias_presentes"),
+            func.sum(case((or_(pd.primeira_entrada.isnot(None), pd.ultima_saida.isnot(None)), 1),
+                          else_=0)).label("dias_trabalhados"),
+            func.count(pd.primeira_entrada).label("entradas"),
+            func.count(pd.inicio_intervalo).label("saidas_almoco"),
+            func.count(pd.fim_intervalo).label("retornos_almoco"),
+            func.count(pd.ultima_saida).label("saidas"),
+            func.coalesce(func.sum(pd.batidas), 0).label("batidas"),
+            func.coalesce(func.sum(pd.batidas_atrasadas), 0).label("batidas_atrasadas"),
+            func.sum(case((pd.batidas_atrasadas > 0, 1), else_=0)).label("dias_com_atraso"),
+            func.coalesce(func.sum(pd.minutos_atraso), 0).label("minutos_atraso"),
+            func.coalesce(func.sum(pd.minutos_atraso_entrada), 0).label("minutos_atraso_entrada"),
+            func.sum(case((pd.entrada_atrasada, 1), else_=0)).label("entradas_atrasadas"),
+            func.sum(case((pd.minutos_atraso_entrada > 0, 1), else_=0)).label("entradas_com_atraso"),
+            func.coalesce(func.sum(pd.minutos_trabalhados), 0).label("minutos_trabalhados"),
+            func.coalesce(func.sum(pd.minutos_extras), 0).label("minutos_extras"),
+        )
+
+    @staticmethod
+    def _filtrar(consulta, estabelecimento_id, data_inicio, data_fim, funcionario_ids=None):
+        consulta = consulta.filter(PontoDiario.data >= data_inicio, PontoDiario.data <= data_fim)
+        if estabelecimento_id is not None:
+            consulta = consulta.filter(PontoDiario.estabelecimento_id == estabelecimento_id)
+        if funcionario_ids is not None:
+            consulta = consulta.filter(PontoDiario.funcionario_id.in_(list(funcionario_ids)))
+        return consulta
+
+    @staticmethod
+    def _linha(row) -> dict:
+        return {k: int(v or 0) for k, v in row._asdict().items() if k not in ("funcionario_id", "data")}
+
+    @staticmethod
+    def resumo_por_funcionario(estabelecimento_id, data_inicio, data_fim, funcionario_ids=None) -> Dict[int, dict]:
+        """{funcionario_id: totais do período} — um GROUP BY funcionario_id."""
+        consulta = db.session.query(PontoDiario.funcionario_id, *PontoDiarioService._somas())
+        consulta = PontoDiarioService._filtrar(consulta, estabelecimento_id, data_inicio, data_fim, funcionario_ids)
+        return {r.funcionario_id: PontoDiarioService._linha(r)
+                for r in consulta.group_by(PontoDiario.funcionario_id)}
+
+    @staticmethod
+    def serie_diaria(estabelecimento_id, data_inicio, data_fim, funcionario_ids=None) -> Dict[date, dict]:
+        """{data: totais do dia} — um GROUP BY data."""
+        consulta = db.session.query(PontoDiario.data, *PontoDiarioService._somas())
+        consulta = PontoDiarioService._filtrar(consulta, estabelecimento_id, data_inicio, data_fim, funcionario_ids)
+        return {r.data: PontoDiarioService._linha(r) for r in consulta.group_by(PontoDiario.data)}
+
+    @staticmethod
+    def totais(estabelecimento_id, data_inicio, data_fim, funcionario_ids=None) -> dict:
+        consulta = db.session.query(*PontoDiarioService._somas())
+        consulta = PontoDiarioService._filtrar(consulta, estabelecimento_id, data_inicio, data_fim, funcionario_ids)
+        return PontoDiarioService._linha(consulta.one())
+
+    @staticmethod
+    def dias(funcionario_ids, data_inicio, data_fim, estabelecimento_id=None):
+        """Linhas diárias (uma por funcionário/dia) ordenadas por data — para espelho e folha."""
+        consulta = PontoDiarioService._filtrar(PontoDiario.query, estabelecimento_id, data_inicio, data_fim,
+                                               funcionario_ids)
+        return consulta.order_by(PontoDiario.data, PontoDiario.funcionario_id).all()
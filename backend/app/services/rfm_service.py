@@ -1,45 +1,479 @@
 """
 Serviço centralizado de cálculos RFM (Recency, Frequency, Monetary)
 Elimina duplicação em pdv.py, relatorios.py e models.py
+
+Motor em lote: UM SELECT agrupado por cliente calcula recência/frequência/valor
+de todos os clientes do tenant (ou de todos os tenants, no job noturno), e os
+quintis (1-5) saem de window functions no próprio banco. O resultado é gravado
+em clientes_rfm (ClienteRFM) com carimbo calculado_em; telas, relatórios e o
+consultor leem dali em vez de varrer vendas cliente a cliente.
+
+O snapshot guarda uma janela por tenant (a do agendador, app/tasks/rfm_task) e
+só é gravado fora das requisições. Leitura de outra janela — ou de tenant ainda
+sem snapshot — calcula na hora com a mesma consulta, sem persistir.
 """
-from datetime import datetime, timedelta, timezone
-from decimal import Decimal
-from typing import Dict, List, Optional
-from app.models import db, Venda, Cliente
+import logging
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import case, delete, extract, func, select
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Venda, Cliente, ClienteRFM, Estabelecimento, allow_all_tenants
+
+logger = logging.getLogger(__name__)
+
 
 class RFMService:
     """Serviço de análise RFM"""
-    
+
     # Configurações padrão
     JANELA_DIAS = 180
+    VALIDADE_HORAS = 6  # intervalo do recálculo agendado (app/tasks/rfm_task)
     PESO_RECENCY = 0.4
     PESO_FREQUENCY = 0.3
     PESO_MONETARY = 0.3
-    
+    SEGMENTOS_RISCO = ("Em Risco", "Perdido")
+    PERFIS = ("VIP", "Premium", "Final de Semana", "Caçador de Promoções", "Novo", "Raro", "Regular")
+
+    # ------------------------------------------------------------------
+    # Regras de pontuação
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _quintil(posicao: Optional[float]) -> int:
+        """Converte a posição relativa (0..1) do cliente no tenant em score 1-5.
+
+        A posição é o percentil de ponto médio — (percent_rank + cume_dist) / 2 —
+        para que empates (ex.: metade da base com 1 compra) recebam o MESMO score,
+        o que o NTILE puro não garante.
+        """
+        if posicao is None:
+            return 1
+        return max(1, min(5, 1 + int(float(posicao) * 5)))
+
+    @staticmethod
+    def segmentar(r: int, f: int, m: int) -> str:
+        """
+        Segmenta cliente baseado nos scores RFM.
+
+        Segmentos:
+        - Campeão: R≥4, F≥4, M≥4
+        - Fiel: R≥4, F≥3
+        - Em Risco: R≤2, (F≥3 ou M≥3)
+        - Perdido: R=1, F≤2
+        - Regular: Demais
+        """
+        if r >= 4 and f >= 4 and m >= 4:
+            return "Campeão"
+        elif r >= 4 and f >= 3:
+            return "Fiel"
+        elif r <= 2 and (f >= 3 or m >= 3):
+            return "Em Risco"
+        elif r == 1 and f <= 2:
+            return "Perdido"
+        else:
+            return "Regular"
+
+    @staticmethod
+    def _score_ponderado(r: int, f: int, m: int) -> float:
+        return round(
+            r * RFMService.PESO_RECENCY + f * RFMService.PESO_FREQUENCY + m * RFMService.PESO_MONETARY, 2
+        )
+
+    @staticmethod
+    def _atribuir_perfis(metricas: List[Dict]) -> None:
+        """Perfil comportamental (VIP, Premium, Final de Semana...) usado em /clientes/rfm.
+
+        Limiares no percentil 75 de frequência e ticket médio do próprio tenant.
+        """
+        if not metricas:
+            return
+        frequency_sorted = sorted(m["frequency"] for m in metricas)
+        ticket_sorted = sorted(m["ticket_medio"] for m in metricas)
+        freq_alta = frequency_sorted[int(len(frequency_sorted) * 0.75)] if len(frequency_sorted) > 3 else 3
+        ticket_alto = ticket_sorted[int(len(ticket_sorted) * 0.75)] if len(ticket_sorted) > 3 else 100
+
+        for m in metricas:
+            f = m["frequency"]
+            tm = m["ticket_medio"]
+            perfil = "Regular"
+            if f == 1: perfil = "Novo"
+            elif m["recency_days"] > 90 and f < freq_alta: perfil = "Raro"
+            elif f >= freq_alta and tm >= ticket_alto: perfil = "VIP"
+            elif f >= freq_alta or tm >= ticket_alto: perfil = "Premium"
+            elif m["vendas_fds"] > (f * 0.5): perfil = "Final de Semana"
+            elif m["vendas_promo"] > (f * 0.5): perfil = "Caçador de Promoções"
+            m["perfil"] = perfil
+
+    # ------------------------------------------------------------------
+    # Cálculo em lote (uma passada no banco)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def calcular_metricas(
+        estabelecimento_id=None,
+        janela_dias: int = JANELA_DIAS,
+        data_inicio: datetime = None,
+        data_fim: datetime = None,
+    ) -> List[Dict]:
+        """
+        Calcula RFM de todos os clientes com compra no período em UMA consulta.
+
+        Args:
+            estabelecimento_id: ID do tenant; None calcula todos os tenants
+                (quintis particionados por estabelecimento).
+            janela_dias: Janela móvel quando data_inicio não é informada.
+            data_inicio/data_fim: Período explícito (datetimes UTC naive).
+
+        Returns:
+            Lista de dicts (um por cliente) com métricas, scores, segmento e perfil.
+        """
+        # O banco grava datetimes UTC "naive" (utcnow); manter tudo naive aqui.
+        agora = datetime.utcnow()
+        data_fim = data_fim or agora
+        data_inicio = data_inicio or (data_fim - timedelta(days=janela_dias))
+
+        filtros = [
+            Venda.cliente_id.isnot(None),
+            Venda.status == "finalizada",
+            Venda.deleted_at.is_(None),
+            Venda.data_venda >= data_inicio,
+            Venda.data_venda <= data_fim,
+        ]
+        if estabelecimento_id is not None:
+            filtros.append(Venda.estabelecimento_id == estabelecimento_id)
+
+        fim_de_semana = extract("dow", Venda.data_venda).in_([0, 6])
+        agg = (
+            select(
+                Venda.estabelecimento_id.label("estabelecimento_id"),
+                Venda.cliente_id.label("cliente_id"),
+                func.max(Venda.data_venda).label("ultima_compra"),
+                func.count(Venda.id).label("frequency"),
+                func.coalesce(func.sum(Venda.total), 0).label("monetary"),
+                func.sum(case((fim_de_semana, 1), else_=0)).label("vendas_fds"),
+                func.sum(case((Venda.desconto > 0, 1), else_=0)).label("vendas_promo"),
+            )
+            .where(*filtros)
+            .group_by(Venda.estabelecimento_id, Venda.cliente_id)
+            .subquery()
+        )
+
+        def _posicao(coluna):
+            janela = {"partition_by": agg.c.estabelecimento_id, "order_by": coluna}
+            return (func.percent_rank().over(**janela) + func.cume_dist().over(**janela)) / 2.0
+
+        stmt = select(
+            agg,
+            _posicao(agg.c.ultima_compra).label("pos_r"),
+            _posicao(agg.c.frequency).label("pos_f"),
+            _posicao(agg.c.monetary).label("pos_m"),
+        )
+        rows = db.session.execute(stmt).all()
+
+        por_tenant: Dict[int, List[Dict]] = {}
+        for row in rows:
+            frequency = int(row.frequency or 0)
+            monetary = float(row.monetary or 0)
+            r = RFMService._quintil(row.pos_r)
+            f = RFMService._quintil(row.pos_f)
+            m = RFMService._quintil(row.pos_m)
+            por_tenant.setdefault(row.estabelecimento_id, []).append({
+                "estabelecimento_id": row.estabelecimento_id,
+                "cliente_id": row.cliente_id,
+                "ultima_compra": row.ultima_compra,
+                "recency_days": (agora - row.ultima_compra).days if row.ultima_compra else janela_dias,
+                "frequency": frequency,
+                "monetary": round(monetary, 2),
+                "ticket_medio": round(monetary / frequency, 2) if frequency else 0.0,
+                "vendas_fds": int(row.vendas_fds or 0),
+                "vendas_promo": int(row.vendas_promo or 0),
+                "recency_score": r,
+                "frequency_score": f,
+                "monetary_score": m,
+                "segmento": RFMService.segmentar(r, f, m),
+            })
+
+        metricas = []
+        for lista in por_tenant.values():
+            RFMService._atribuir_perfis(lista)
+            metricas.extend(lista)
+        return metricas
+
+    @staticmethod
+    def _persistir(metricas: List[Dict], estabelecimento_ids: Iterable[int], janela_dias: int) -> int:
+        """Substitui os scores dos tenants informados em uma transação (DELETE + INSERT em lote).
+
+        Vai direto na tabela (Core) de propósito: é um snapshot derivado, não deve
+        disparar a auditoria forense por linha nem entrar na fila de sync.
+        """
+        tabela = ClienteRFM.__table__
+        agora = datetime.utcnow()
+        linhas = [
+            {
+                "estabelecimento_id": m["estabelecimento_id"],
+                "cliente_id": m["cliente_id"],
+                "janela_dias": janela_dias,
+                "ultima_compra": m["ultima_compra"],
+                "recency_days": m["recency_days"],
+                "frequency": m["frequency"],
+                "monetary": m["monetary"],
+                "ticket_medio": m["ticket_medio"],
+                "vendas_fds": m["vendas_fds"],
+                "vendas_promo": m["vendas_promo"],
+                "recency_score": m["recency_score"],
+                "frequency_score": m["frequency_score"],
+                "monetary_score": m["monetary_score"],
+                "segmento": m["segmento"],
+                "perfil": m["perfil"],
+                "calculado_em": agora,
+            }
+            for m in metricas
+        ]
+        ids = list(estabelecimento_ids)
+        try:
+            if ids:
+                db.session.execute(delete(tabela).where(tabela.c.estabelecimento_id.in_(ids)))
+            else:
+                db.session.execute(delete(tabela))
+            if linhas:
+                db.session.execute(tabela.insert(), linhas)
+            db.session.commit()
+        except IntegrityError:
+            # Outro worker recalculou o mesmo tenant ao mesmo tempo; o snapshot dele vale.
+            db.session.rollback()
+            logger.info("RFM: recálculo concorrente detectado para %s; mantendo snapshot existente.", ids)
+        return len(linhas)
+
+    @staticmethod
+    def recalcular_estabelecimento(estabelecimento_id: int, janela_dias: int = JANELA_DIAS) -> int:
+        """Recalcula e persiste os scores de um tenant. Retorna o nº de clientes pontuados."""
+        metricas = RFMService.calcular_metricas(estabelecimento_id, janela_dias=janela_dias)
+        return RFMService._persistir(metricas, [estabelecimento_id], janela_dias)
+
+    @staticmethod
+    def recalcular_todos(janela_dias: int = JANELA_DIAS) -> int:
+        """Job de plataforma: recalcula TODOS os tenants em uma única passada."""
+        with allow_all_tenants():
+            metricas = RFMService.calcular_metricas(None, janela_dias=janela_dias)
+            ids = [i for (i,) in db.session.query(Estabelecimento.id).all()]
+            return RFMService._persistir(metricas, ids, janela_dias)
+
+    @staticmethod
+    def _tem_snapshot(estabelecimento_id, janela_dias: int) -> bool:
+        """O snapshot persistido é desta janela? Se não, a leitura calcula na hora."""
+        q = db.session.query(ClienteRFM.id).filter(ClienteRFM.janela_dias == janela_dias)
+        if str(estabelecimento_id).lower() != "all":
+            q = q.filter(ClienteRFM.estabelecimento_id == estabelecimento_id)
+        return q.first() is not None
+
+    @staticmethod
+    def _metricas_ao_vivo(estabelecimento_id, janela_dias: int) -> List[Dict]:
+        """Mesma consulta do motor, sem gravar: janelas fora do snapshot não o sobrescrevem."""
+        return RFMService.calcular_metricas(
+            None if str(estabelecimento_id).lower() == "all" else estabelecimento_id, janela_dias=janela_dias
+        )
+
+    # ------------------------------------------------------------------
+    # Leitura dos scores persistidos
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _query_scores(estabelecimento_id, janela_dias: int = JANELA_DIAS):
+        q = (
+            db.session.query(ClienteRFM, Cliente)
+            .join(Cliente, Cliente.id == ClienteRFM.cliente_id)
+            .filter(Cliente.ativo == True, Cliente.deleted_at.is_(None),  # noqa: E712
+                    ClienteRFM.janela_dias == janela_dias)
+        )
+        if str(estabelecimento_id).lower() != "all":
+            q = q.filter(ClienteRFM.estabelecimento_id == estabelecimento_id)
+        return q
+
+    @staticmethod
+    def listar_scores(
+        estabelecimento_id,
+        janela_dias: int = JANELA_DIAS,
+        segmento: str = None,
+        apenas_risco: bool = False,
+    ) -> List[Dict]:
+        """Scores do snapshot (ou calculados na hora, fora dele), do mais valioso ao menos."""
+        if not RFMService._tem_snapshot(estabelecimento_id, janela_dias):
+            return RFMService._listar_ao_vivo(estabelecimento_id, janela_dias, segmento, apenas_risco)
+        q = RFMService._query_scores(estabelecimento_id, janela_dias)
+        if segmento:
+            q = q.filter(ClienteRFM.segmento == segmento)
+        if apenas_risco:
+            q = q.filter(ClienteRFM.segmento.in_(RFMService.SEGMENTOS_RISCO))
+
+        agora = datetime.utcnow()
+        resultado = []
+        for score, cliente in q.order_by(ClienteRFM.monetary.desc()).all():
+            resultado.append({
+                "cliente_id": cliente.id,
+                "nome": cliente.nome,
+                "email": cliente.email,
+                "celular": cliente.celular,
+                "telefone": cliente.telefone,
+                "saldo_devedor": float(cliente.saldo_devedor or 0),
+                "score_credito": int(cliente.score_credito or 500),
+                "ultima_compra": score.ultima_compra,
+                "recency_days": (agora - score.ultima_compra).days if score.ultima_compra else score.recency_days,
+                "recency_score": score.recency_score,
+                "frequency": int(score.frequency or 0),
+                "frequency_score": score.frequency_score,
+                "monetary": round(float(score.monetary or 0), 2),
+                "monetary_score": score.monetary_score,
+                "ticket_medio": float(score.ticket_medio or 0),
+                "vendas_fds": int(score.vendas_fds or 0),
+                "vendas_promo": int(score.vendas_promo or 0),
+                "segmento": score.segmento,
+                "perfil": score.perfil,
+                "rfm_score": score.rfm_score,
+                "calculado_em": score.calculado_em,
+            })
+        return resultado
+
+    @staticmethod
+    def _listar_ao_vivo(estabelecimento_id, janela_dias: int, segmento: str = None,
+                        apenas_risco: bool = False) -> List[Dict]:
+        """listar_scores para janela sem snapshot: mesmo formato, nada gravado."""
+        metricas = [
+            m for m in RFMService._metricas_ao_vivo(estabelecimento_id, janela_dias)
+            if (not segmento or m["segmento"] == segmento)
+            and (not apenas_risco or m["segmento"] in RFMService.SEGMENTOS_RISCO)
+        ]
+        if not metricas:
+            return []
+        clientes = {
+            c.id: c for c in Cliente.query.filter(
+                Cliente.id.in_([m["cliente_id"] for m in metricas]),
+                Cliente.ativo == True, Cliente.deleted_at.is_(None),  # noqa: E712
+            ).all()
+        }
+        resultado = []
+        for m in sorted(metricas, key=lambda x: x["monetary"], reverse=True):
+            cliente = clientes.get(m["cliente_id"])
+            if cliente is None:
+                continue
+            resultado.append({
+                **m,
+                "nome": cliente.nome,
+                "email": cliente.email,
+                "celular": cliente.celular,
+                "telefone": cliente.telefone,
+                "saldo_devedor": float(cliente.saldo_devedor or 0),
+                "score_credito": int(cliente.score_credito or 500),
+                "rfm_score": f"{m['recency_score']}{m['frequency_score']}{m['monetary_score']}",
+                "calculado_em": None,
+            })
+        return resultado
+
+    @staticmethod
+    def contar_segmentos(estabelecimento_id, janela_dias: int = JANELA_DIAS) -> Dict[str, Dict]:
+        """{segmento: {quantidade, valor_total}} agregado no banco a partir do snapshot."""
+        if not RFMService._tem_snapshot(estabelecimento_id, janela_dias):
+            segmentos: Dict[str, Dict] = {}
+            for m in RFMService._metricas_ao_vivo(estabelecimento_id, janela_dias):
+                dados = segmentos.setdefault(m["segmento"], {"quantidade": 0, "valor_total": 0.0})
+                dados["quantidade"] += 1
+                dados["valor_total"] = round(dados["valor_total"] + m["monetary"], 2)
+            return segmentos
+        q = db.session.query(
+            ClienteRFM.segmento,
+            func.count(ClienteRFM.id),
+            func.coalesce(func.sum(ClienteRFM.monetary), 0),
+        ).filter(ClienteRFM.janela_dias == janela_dias)
+        if str(estabelecimento_id).lower() != "all":
+            q = q.filter(ClienteRFM.estabelecimento_id == estabelecimento_id)
+        return {
+            seg: {"quantidade": int(qtd), "valor_total": round(float(valor or 0), 2)}
+            for seg, qtd, valor in q.group_by(ClienteRFM.segmento).all()
+        }
+
+    @staticmethod
+    def resumo_perfis(estabelecimento_id, janela_dias: int = JANELA_DIAS) -> Dict:
+        """Payload de /clientes/rfm (perfis comportamentais + crédito), lido do snapshot."""
+        scores = RFMService.listar_scores(estabelecimento_id, janela_dias)
+        if not scores:
+            return {"segments": {}, "customers": [], "consumidor_final": {}, "window_days": janela_dias}
+
+        segments_count = {perfil: 0 for perfil in RFMService.PERFIS}
+        customers = []
+        for s in scores:
+            segments_count[s["perfil"]] = segments_count.get(s["perfil"], 0) + 1
+
+            risco = "BAIXO"
+            if s["saldo_devedor"] > 0:
+                if s["score_credito"] < 300: risco = "ALTO"
+                elif s["score_credito"] < 700: risco = "MEDIO"
+
+            bom_pagador = s["saldo_devedor"] == 0 or s["score_credito"] >= 700
+            sugestao_limite = round(s["ticket_medio"] * s["frequency"] * 0.3, 2) if s["score_credito"] >= 600 else 0
+
+            customers.append({
+                "cliente_id": s["cliente_id"],
+                "nome": s["nome"],
+                "recency_days": s["recency_days"],
+                "frequency": s["frequency"],
+                "monetary": s["monetary"],
+                "ticket_medio": s["ticket_medio"],
+                "saldo_devedor": s["saldo_devedor"],
+                "score_credito": s["score_credito"],
+                "vendas_fds": s["vendas_fds"],
+                "vendas_promo": s["vendas_promo"],
+                "segment": s["perfil"],
+                "segmento_rfm": s["segmento"],
+                "rfm_score": s["rfm_score"],
+                "risco_inadimplencia": risco,
+                "bom_pagador": bom_pagador,
+                "sugestao_limite": sugestao_limite,
+            })
+
+        q = db.session.query(
+            func.count(Venda.id),
+            func.sum(case((Venda.cliente_id.is_(None), 1), else_=0)),
+            func.sum(case((Venda.cliente_id.is_(None), Venda.total), else_=0)),
+        ).filter(Venda.status == "finalizada")
+        if str(estabelecimento_id).lower() != "all":
+            q = q.filter(Venda.estabelecimento_id == estabelecimento_id)
+        total_vendas, cf_vendas, cf_valor = q.one()
+
+        consumidor_final = {
+            "percentual_vendas": round((cf_vendas / total_vendas * 100) if total_vendas else 0, 1),
+            "valor_arrecadado": float(cf_valor or 0),
+        }
+
+        return {
+            "segments": segments_count,
+            "customers": customers,
+            "consumidor_final": consumidor_final,
+            "window_days": janela_dias,
+        }
+
     @staticmethod
     def calcular_rfm_cliente(cliente_id: int, estabelecimento_id: int, janela_dias: int = JANELA_DIAS) -> Dict:
         """
-        Calcula métricas RFM para um cliente específico
-        
+        Retorna métricas RFM de um cliente a partir do snapshot persistido
+
         Args:
             cliente_id: ID do cliente
             estabelecimento_id: ID do estabelecimento
             janela_dias: Janela de análise em dias
-            
+
         Returns:
             Dict com métricas RFM e segmento
         """
-        data_inicio = datetime.now(timezone.utc) - timedelta(days=janela_dias)
-        
-        # Buscar vendas do cliente
-        vendas = Venda.query.filter(
-            Venda.estabelecimento_id == estabelecimento_id,
-            Venda.cliente_id == cliente_id,
-            Venda.data_venda >= data_inicio,
-            Venda.status == "finalizada"
-        ).all()
-        
-        if not vendas:
+        if RFMService._tem_snapshot(estabelecimento_id, janela_dias):
+            score = ClienteRFM.query.filter_by(
+                estabelecimento_id=estabelecimento_id, cliente_id=cliente_id, janela_dias=janela_dias
+            ).first()
+        else:
+            score = next((
+                SimpleNamespace(**m) for m in RFMService._metricas_ao_vivo(estabelecimento_id, janela_dias)
+                if m["cliente_id"] == cliente_id
+            ), None)
+
+        if not score:
             return {
                 "segmento": "Novo",
                 "sugerir_desconto": False,
@@ -52,221 +486,101 @@ class RFMService:
                 "rfm_score": 0,
                 "ultima_compra": None
             }
-        
-        # Calcular métricas
-        now = datetime.now(timezone.utc)
-        ultima_compra = max(v.data_venda for v in vendas)
-        recency_days = (now - ultima_compra).days
-        frequency = len(vendas)
-        monetary = sum(float(v.total) for v in vendas)
-        
-        # Calcular scores (1-5)
-        recency_score = RFMService._calcular_recency_score(recency_days)
-        frequency_score = RFMService._calcular_frequency_score(frequency)
-        monetary_score = RFMService._calcular_monetary_score(monetary)
-        
-        # Score RFM ponderado
-        rfm_score = (
-            recency_score * RFMService.PESO_RECENCY +
-            frequency_score * RFMService.PESO_FREQUENCY +
-            monetary_score * RFMService.PESO_MONETARY
-        )
-        
-        # Determinar segmento
-        segmento = RFMService._determinar_segmento(recency_score, frequency_score, monetary_score)
-        
-        # Sugerir desconto para clientes em risco
-        sugerir_desconto = segmento in ["Em Risco", "Hibernando", "Perdido"]
-        
+
+        recency_days = (datetime.utcnow() - score.ultima_compra).days if score.ultima_compra else score.recency_days
         return {
-            "segmento": segmento,
-            "sugerir_desconto": sugerir_desconto,
+            "segmento": score.segmento,
+            "sugerir_desconto": score.segmento in RFMService.SEGMENTOS_RISCO,
             "recency_days": recency_days,
-            "recency_score": recency_score,
-            "frequency": frequency,
-            "frequency_score": frequency_score,
-            "monetary": round(monetary, 2),
-            "monetary_score": monetary_score,
-            "rfm_score": round(rfm_score, 2),
-            "ultima_compra": ultima_compra.isoformat() if ultima_compra else None
+            "recency_score": score.recency_score,
+            "frequency": int(score.frequency or 0),
+            "frequency_score": score.frequency_score,
+            "monetary": round(float(score.monetary or 0), 2),
+            "monetary_score": score.monetary_score,
+            "rfm_score": RFMService._score_ponderado(score.recency_score, score.frequency_score, score.monetary_score),
+            "ultima_compra": score.ultima_compra.isoformat() if score.ultima_compra else None
         }
-    
-    @staticmethod
-    def _calcular_recency_score(recency_days: int) -> int:
-        """Calcula score de recência (quanto menor, melhor)"""
-        if recency_days <= 30:
-            return 5
-        elif recency_days <= 60:
-            return 4
-        elif recency_days <= 90:
-            return 3
-        elif recency_days <= 120:
-            return 2
-        else:
-            return 1
-    
-    @staticmethod
-    def _calcular_frequency_score(frequency: int) -> int:
-        """Calcula score de frequência (quanto maior, melhor)"""
-        if frequency >= 10:
-            return 5
-        elif frequency >= 7:
-            return 4
-        elif frequency >= 4:
-            return 3
-        elif frequency >= 2:
-            return 2
-        else:
-            return 1
-    
-    @staticmethod
-    def _calcular_monetary_score(monetary: float) -> int:
-        """Calcula score monetário (quanto maior, melhor)"""
-        if monetary >= 1000:
-            return 5
-        elif monetary >= 500:
-            return 4
-        elif monetary >= 200:
-            return 3
-        elif monetary >= 50:
-            return 2
-        else:
-            return 1
-    
-    @staticmethod
-    def _determinar_segmento(r: int, f: int, m: int) -> str:
-        """
-        Determina segmento do cliente baseado em scores RFM
-        
-        Segmentos:
-        - Campeões: R=5, F=5, M=5
-        - Leais: R>=4, F>=4
-        - Potencial: R>=4, F<4
-        - Novos: R>=4, F=1
-        - Promissores: R>=3, F<=2, M>=3
-        - Precisa Atenção: R=3, F<=3
-        - Em Risco: R=2
-        - Hibernando: R=1, F>=2
-        - Perdido: R=1, F=1
-        """
-        if r == 5 and f == 5 and m == 5:
-            return "Campeões"
-        elif r >= 4 and f >= 4:
-            return "Leais"
-        elif r >= 4 and f == 1:
-            return "Novos"
-        elif r >= 4 and f < 4:
-            return "Potencial"
-        elif r >= 3 and f <= 2 and m >= 3:
-            return "Promissores"
-        elif r == 3 and f <= 3:
-            return "Precisa Atenção"
-        elif r == 2:
-            return "Em Risco"
-        elif r == 1 and f >= 2:
-            return "Hibernando"
-        else:
-            return "Perdido"
-    
+
     @staticmethod
     def calcular_rfm_estabelecimento(estabelecimento_id: int, janela_dias: int = JANELA_DIAS) -> Dict:
         """
         Calcula análise RFM para todos os clientes do estabelecimento
-        
+
         Args:
             estabelecimento_id: ID do estabelecimento
             janela_dias: Janela de análise em dias
-            
+
         Returns:
             Dict com análise agregada
         """
-        data_inicio = datetime.now(timezone.utc) - timedelta(days=janela_dias)
-        
-        # Buscar clientes com vendas
-        clientes_com_vendas = db.session.query(Cliente.id).join(
-            Venda, Cliente.id == Venda.cliente_id
-        ).filter(
-            Cliente.estabelecimento_id == estabelecimento_id,
-            Venda.data_venda >= data_inicio,
-            Venda.status == "finalizada"
-        ).distinct().all()
-        
-        # Calcular RFM para cada cliente
-        segmentos = {}
-        total_clientes = 0
-        
-        for (cliente_id,) in clientes_com_vendas:
-            rfm = RFMService.calcular_rfm_cliente(cliente_id, estabelecimento_id, janela_dias)
-            segmento = rfm["segmento"]
-            
-            if segmento not in segmentos:
-                segmentos[segmento] = {
-                    "quantidade": 0,
-                    "valor_total": 0,
-                    "ticket_medio": 0
-                }
-            
-            segmentos[segmento]["quantidade"] += 1
-            segmentos[segmento]["valor_total"] += rfm["monetary"]
-            total_clientes += 1
-        
-        # Calcular ticket médio por segmento
-        for segmento in segmentos:
-            if segmentos[segmento]["quantidade"] > 0:
-                segmentos[segmento]["ticket_medio"] = round(
-                    segmentos[segmento]["valor_total"] / segmentos[segmento]["quantidade"],
-                    2
-                )
-        
+        segmentos = RFMService.contar_segmentos(estabelecimento_id, janela_dias)
+        for dados in segmentos.values():
+            dados["ticket_medio"] = round(dados["valor_total"] / dados["quantidade"], 2) if dados["quantidade"] else 0
+
         return {
-            "total_clientes": total_clientes,
+            "total_clientes": sum(d["quantidade"] for d in segmentos.values()),
             "segmentos": segmentos,
             "janela_dias": janela_dias,
-            "data_analise": datetime.now(timezone.utc).isoformat()
+            "data_analise": datetime.utcnow().isoformat()
         }
-    
+
     @staticmethod
     def obter_clientes_em_risco(estabelecimento_id: int, limite: int = 10) -> List[Dict]:
         """
         Retorna lista de clientes em risco de churn
-        
+
         Args:
             estabelecimento_id: ID do estabelecimento
             limite: Número máximo de clientes
-            
+
         Returns:
-            Lista de clientes em risco
+            Lista de clientes em risco (maior risco primeiro)
         """
-        data_inicio = datetime.now(timezone.utc) - timedelta(days=RFMService.JANELA_DIAS)
-        
-        # Buscar clientes com vendas
-        clientes = db.session.query(Cliente).join(
-            Venda, Cliente.id == Venda.cliente_id
-        ).filter(
-            Cliente.estabelecimento_id == estabelecimento_id,
-            Venda.data_venda >= data_inicio,
-            Venda.status == "finalizada"
-        ).distinct().all()
-        
-        clientes_em_risco = []
-        
-        for cliente in clientes:
-            rfm = RFMService.calcular_rfm_cliente(cliente.id, estabelecimento_id)
-            
-            if rfm["segmento"] in ["Em Risco", "Hibernando", "Perdido"]:
-                clientes_em_risco.append({
-                    "cliente_id": cliente.id,
-                    "nome": cliente.nome,
-                    "email": cliente.email,
-                    "telefone": cliente.telefone,
-                    "segmento": rfm["segmento"],
-                    "recency_days": rfm["recency_days"],
-                    "frequency": rfm["frequency"],
-                    "monetary": rfm["monetary"],
-                    "rfm_score": rfm["rfm_score"]
-                })
-        
-        # Ordenar por score RFM (menor primeiro = maior risco)
-        clientes_em_risco.sort(key=lambda x: x["rfm_score"])
-        
-        return clientes_em_risco[:limite]
+        if not RFMService._tem_snapshot(estabelecimento_id, RFMService.JANELA_DIAS):
+            scores = RFMService.listar_scores(estabelecimento_id, apenas_risco=True)
+            scores.sort(key=lambda s: (
+                RFMService._score_ponderado(s["recency_score"], s["frequency_score"], s["monetary_score"]),
+                -s["monetary"]))
+            return [
+                {
+                    "cliente_id": s["cliente_id"],
+                    "nome": s["nome"],
+                    "email": s["email"],
+                    "telefone": s["telefone"],
+                    "segmento": s["segmento"],
+                    "recency_days": s["recency_days"],
+                    "frequency": s["frequency"],
+                    "monetary": s["monetary"],
+                    "rfm_score": RFMService._score_ponderado(
+                        s["recency_score"], s["frequency_score"], s["monetary_score"]),
+                }
+                for s in scores[:limite]
+            ]
+        ponderado = (
+            ClienteRFM.recency_score * RFMService.PESO_RECENCY
+            + ClienteRFM.frequency_score * RFMService.PESO_FREQUENCY
+            + ClienteRFM.monetary_score * RFMService.PESO_MONETARY
+        )
+        linhas = (
+            RFMService._query_scores(estabelecimento_id)
+            .filter(ClienteRFM.segmento.in_(RFMService.SEGMENTOS_RISCO))
+            .order_by(ponderado.asc(), ClienteRFM.monetary.desc())
+            .limit(limite)
+            .all()
+        )
+
+        agora = datetime.utcnow()
+        return [
+            {
+                "cliente_id": cliente.id,
+                "nome": cliente.nome,
+                "email": cliente.email,
+                "telefone": cliente.telefone,
+                "segmento": score.segmento,
+                "recency_days": (agora - score.ultima_compra).days if score.ultima_compra else score.recency_days,
+                "frequency": int(score.frequency or 0),
+                "monetary": round(float(score.monetary or 0), 2),
+                "rfm_score": RFMService._score_ponderado(score.recency_score, score.frequency_score, score.monetary_score),
+            }
+            for score, cliente in linhas
+        ]
@@ -10,9 +10,10 @@ Convenções:
   normal (ConfiguracaoHorario.jornada_diaria_minutos, padrão 8h) vira extra.
 - Atraso vem do minutos_atraso gravado em cada RegistroPonto no momento da
   batida (respeita a tolerância configurada).
+- Espelho e folha leem o consolidado diário (PontoDiario, mantido a cada
+  batida pelo ponto_diario_service com esta mesma regra), não as batidas.
 - Valores monetários usam Decimal e são arredondados a 2 casas (ROUND_HALF_UP).
 """
-from collections import defaultdict
 from datetime import datetime, date, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 import calendar
@@ -91,7 +92,7 @@ def limites_do_mes(ano_mes: str):
 
 def calcular_espelho_ponto(funcionario, data_inicio, data_fim, config=None):
     """
-    Agrega os RegistroPonto do período em registros diários + resumo.
+    Lê o consolidado diário do período (PontoDiario) em registros diários + resumo.
 
     Tipos reais gravados por registrar_ponto: entrada, saida_almoco (início da
     pausa), retorno_almoco (fim da pausa), saida (saída final). Horas extras =
@@ -100,8 +101,8 @@ def calcular_espelho_ponto(funcionario, data_inicio, data_fim, config=None):
     Retorna dict pronto para serialização (sem dados de assinatura, que são
     responsabilidade do endpoint).
     """
-    from sqlalchemy import and_
-    from app.models import RegistroPonto, ConfiguracaoHorario
+    from app.models import ConfiguracaoHorario
+    from app.services.ponto_diario_service import PontoDiarioService
 
     if config is None:
         config = ConfiguracaoHorario.query.filter_by(
@@ -111,76 +112,33 @@ def calcular_espelho_ponto(funcionario, data_inicio, data_fim, config=None):
     jornada_normal = (config.jornada_diaria_minutos if config and config.jornada_diaria_minutos
                       else JORNADA_PADRAO_MIN)
 
-    registros = (RegistroPonto.query
-                 .filter(and_(
-                     RegistroPonto.funcionario_id == funcionario.id,
-                     RegistroPonto.data >= data_inicio,
-                     RegistroPonto.data <= data_fim,
-                 ))
-                 .order_by(RegistroPonto.data, RegistroPonto.hora)
-                 .all())
-
-    registros_por_dia = defaultdict(list)
-    for r in registros:
-        registros_por_dia[r.data].append(r)
-
     registros_diarios = []
     total_dias = total_atrasos = total_min_atraso = 0
     total_min_extras = 0
     total_min_trabalhados = 0
 
-    for dia, regs in sorted(registros_por_dia.items()):
-        entrada = saida = intervalo_inicio = intervalo_fim = None
-        minutos_atraso = 0
-        observacao = None
-        tem_saida = False
-
-        for r in regs:
-            if r.tipo_registro == "entrada":
-                entrada = _fmt_hora(r.hora)
-                minutos_atraso += r.minutos_atraso or 0
-            elif r.tipo_registro == "saida_almoco":
-                intervalo_inicio = _fmt_hora(r.hora)
-                minutos_atraso += r.minutos_atraso or 0
-            elif r.tipo_registro == "retorno_almoco":
-                intervalo_fim = _fmt_hora(r.hora)
-                minutos_atraso += r.minutos_atraso or 0
-            elif r.tipo_registro == "saida":
-                saida = _fmt_hora(r.hora)
-                tem_saida = True
-            if r.observacao:
-                observacao = r.observacao
-
-        # Minutos trabalhados no dia, descontando a pausa de almoço
-        minutos_trabalhados = 0
-        if entrada and saida:
-            try:
-                e = datetime.strptime(entrada, "%H:%M")
-                s = datetime.strptime(saida, "%H:%M")
-                diff = (s - e).total_seconds() / 60
-                if intervalo_inicio and intervalo_fim:
-                    ii = datetime.strptime(intervalo_inicio, "%H:%M")
-                    iff = datetime.strptime(intervalo_fim, "%H:%M")
-                    diff -= (iff - ii).total_seconds() / 60
-                minutos_trabalhados = max(0, diff)
-            except Exception:
-                minutos_trabalhados = 0
+    # Uma linha por dia (consolidado); pausa de almoço já descontada
+    for dia in PontoDiarioService.dias([funcionario.id], data_inicio, data_fim):
+        entrada = _fmt_hora(dia.primeira_entrada)
+        saida = _fmt_hora(dia.ultima_saida)
+        minutos_trabalhados = dia.minutos_trabalhados or 0
+        minutos_atraso = dia.minutos_atraso or 0
 
         # Hora extra (CLT): o que passar da jornada normal do dia
         minutos_extras = 0
-        if tem_saida and entrada and saida:
+        if entrada and saida:
             minutos_extras = max(0, int(minutos_trabalhados - jornada_normal))
 
         registros_diarios.append({
-            "data": dia.isoformat(),
+            "data": dia.data.isoformat(),
             "entrada": entrada,
             "saida": saida,
-            "intervalo_inicio": intervalo_inicio,
-            "intervalo_fim": intervalo_fim,
+            "intervalo_inicio": _fmt_hora(dia.inicio_intervalo),
+            "intervalo_fim": _fmt_hora(dia.fim_intervalo),
             "minutos_atraso": minutos_atraso,
             "minutos_extras": minutos_extras,
             "horas_trabalhadas": minutos_trabalhados,
-            "observacao": observacao,
+            "observacao": dia.observacao,
         })
 
         if entrada or saida:
@@ -215,12 +173,37 @@ def calcular_espelho_ponto(funcionario, data_inicio, data_fim, config=None):
 # HOLERITE (folha mensal) — 100% no backend, lendo ConfiguracaoFolha
 # ---------------------------------------------------------------------------
 
-def calcular_holerite(funcionario, mes_referencia: str, config_folha=None) -> dict:
+def resumo_ponto_consolidado(totais: dict, jornada_min: int = JORNADA_PADRAO_MIN) -> dict:
+    """Totais agrupados do PontoDiario (PontoDiarioService.resumo_por_funcionario)
+    no formato do ``resumo`` do espelho — para o processamento em lote da folha,
+    que não monta o espelho dia a dia de cada funcionário."""
+    totais = totais or {}
+    dias = totais.get("dias_trabalhados", 0)
+    minutos_trabalhados = totais.get("minutos_trabalhados", 0)
+    minutos_extras = totais.get("minutos_extras", 0)
+    return {
+        "total_dias_trabalhados": dias,
+        "total_atrasos": totais.get("dias_com_atraso", 0),
+        "total_minutos_atraso": totais.get("minutos_atraso", 0),
+        "total_minutos_extras": minutos_extras,
+        "total_horas_extras": round(minutos_extras / 60, 2),
+        "total_horas_trabalhadas": round(minutos_trabalhados / 60, 2),
+        "media_horas_dia": round(minutos_trabalhados / 60 / dias, 2) if dias else 0,
+        "jornada_diaria_minutos": jornada_min,
+    }
+
+
+def calcular_holerite(funcionario, mes_referencia: str, config_folha=None,
+                      resumo_ponto=None, beneficios=None) -> dict:
     """
     Holerite do mês com proventos/descontos/líquido e memória de cálculo,
     lendo TODOS os parâmetros da ConfiguracaoFolha (divisor de horas, % hora
     extra, tabelas de INSS/IRRF, FGTS, desconto de VT). Hora extra e atraso
     vêm da engine do espelho (dados reais de ponto).
+
+    O processamento em lote (folha_service) passa ``resumo_ponto`` (resumo do
+    espelho já agregado) e ``beneficios`` ([(nome, valor)]) carregados de uma
+    vez para a loja inteira; sem eles, são consultados aqui.
     """
     from app.models import db, FuncionarioBeneficio, Beneficio
 
@@ -228,10 +211,11 @@ def calcular_holerite(funcionario, mes_referencia: str, config_folha=None) -> di
         config_folha = obter_config_folha(funcionario.estabelecimento_id)
 
     salario = _D(funcionario.salario_base)
-    inicio, fim = limites_do_mes(mes_referencia)
-    espelho = calcular_espelho_ponto(funcionario, inicio, fim)
-    horas_extras = _D(espelho["resumo"]["total_horas_extras"])
-    horas_atraso = _D(espelho["resumo"]["total_minutos_atraso"]) / Decimal(60)
+    if resumo_ponto is None:
+        inicio, fim = limites_do_mes(mes_referencia)
+        resumo_ponto = calcular_espelho_ponto(funcionario, inicio, fim)["resumo"]
+    horas_extras = _D(resumo_ponto["total_horas_extras"])
+    horas_atraso = _D(resumo_ponto["total_minutos_atraso"]) / Decimal(60)
 
     divisor = Decimal(config_folha.divisor_horas_mensais or 220)
     valor_hora = (salario / divisor) if divisor else Decimal(0)
@@ -249,14 +233,15 @@ def calcular_holerite(funcionario, mes_referencia: str, config_folha=None) -> di
         memoria.append(f"Hora extra: {float(horas_extras):.2f}h × (R${_q2(salario)}/{int(divisor)}) × (1+{int(pct_he)}%) = R${_q2(valor_he)}")
 
     # Benefícios ativos (VT/VA etc.) entram como provento
-    beneficios = (db.session.query(FuncionarioBeneficio)
-                  .join(Beneficio, FuncionarioBeneficio.beneficio_id == Beneficio.id)
-                  .filter(FuncionarioBeneficio.funcionario_id == funcionario.id,
-                          FuncionarioBeneficio.ativo == True).all())
+    if beneficios is None:
+        beneficios = [(fb.beneficio.nome if fb.beneficio else "Benefício", fb.valor)
+                      for fb in (db.session.query(FuncionarioBeneficio)
+                                 .join(Beneficio, FuncionarioBeneficio.beneficio_id == Beneficio.id)
+                                 .filter(FuncionarioBeneficio.funcionario_id == funcionario.id,
+                                         FuncionarioBeneficio.ativo == True).all())]
     tem_vt = False
-    for fb in beneficios:
-        nome = (fb.beneficio.nome if fb.beneficio else "Benefício")
-        vencimentos.append({"descricao": nome, "referencia": "Benefício", "valor": _q2(fb.valor or 0)})
+    for nome, valor in beneficios:
+        vencimentos.append({"descricao": nome, "referencia": "Benefício", "valor": _q2(valor or 0)})
         if "transp" in nome.lower() or nome.strip().upper() in ("VT", "VALE TRANSPORTE"):
             tem_vt = True
 
@@ -551,7 +536,7 @@ def calcular_rescisao(funcionario, data_demissao: date, tipo_rescisao: str,
     }
 
 
-def calcular_retrospectiva(funcionario, data_inicio: date, data_fim: date) -> dict:
+def calcular_retrospectiva(funcionario, data_inicio: date, data_fim: date, resumo_ponto=None) -> dict:
     """
     'Retrospectiva' (estilo Spotify Wrapped) do funcionário no período, com
     dados 100% REAIS do sistema:
@@ -559,20 +544,21 @@ def calcular_retrospectiva(funcionario, data_inicio: date, data_fim: date) -> di
       - vendas realizadas, faturamento, ticket médio, clientes atendidos
       - produtos passados (itens de venda) e mercadorias conferidas (entradas)
     Cada métrica só aparece se houver dado real; nada é inventado.
+    ``resumo_ponto`` (resumo do espelho já agregado) dispensa o espelho.
     """
     import re
     from sqlalchemy import func as sqlfunc, and_, case
     from app.models import db, Venda, VendaItem, MovimentacaoEstoque, Motorista, Entrega, EntregaItem
+    from app.utils.query_helpers import filtro_periodo
 
     # --- Ponto (reaproveita a engine única) ---
-    espelho = calcular_espelho_ponto(funcionario, data_inicio, data_fim)
-    resumo_ponto = espelho["resumo"]
+    if resumo_ponto is None:
+        resumo_ponto = calcular_espelho_ponto(funcionario, data_inicio, data_fim)["resumo"]
 
     escopo_venda = and_(
         Venda.funcionario_id == funcionario.id,
         Venda.status == "finalizada",
-        sqlfunc.date(Venda.data_venda) >= data_inicio,
-        sqlfunc.date(Venda.data_venda) <= data_fim,
+        filtro_periodo(Venda.data_venda, data_inicio, data_fim),
     )
 
     # --- Vendas / faturamento / clientes ---
@@ -598,8 +584,7 @@ def calcular_retrospectiva(funcionario, data_inicio: date, data_fim: date) -> di
     ).filter(
         MovimentacaoEstoque.funcionario_id == funcionario.id,
         MovimentacaoEstoque.tipo.in_(["entrada", "ENTRADA", "compra", "recebimento"]),
-        sqlfunc.date(MovimentacaoEstoque.created_at) >= data_inicio,
-        sqlfunc.date(MovimentacaoEstoque.created_at) <= data_fim,
+        filtro_periodo(MovimentacaoEstoque.created_at, data_inicio, data_fim),
     ).first()
 
     # --- Entregas (motoboy/entregador): vincula Funcionário → Motorista por CPF ---
@@ -616,12 +601,11 @@ def calcular_retrospectiva(funcionario, data_inicio: date, data_fim: date) -> di
                 motorista = m
                 break
     if motorista:
-        data_ref = sqlfunc.coalesce(Entrega.data_entrega, Entrega.data_saida, Entrega.created_at)
+        data_ref = Entrega.data_referencia
         escopo_entrega = and_(
             Entrega.motorista_id == motorista.id,
             Entrega.status.notin_(["cancelada", "cancelado"]),
-            sqlfunc.date(data_ref) >= data_inicio,
-            sqlfunc.date(data_ref) <= data_fim,
+            filtro_periodo(data_ref, data_inicio, data_fim),
         )
         # km: usa km_percorridos quando registrado (>0), senão a distância da entrega
         km_expr = sqlfunc.sum(case((Entrega.km_percorridos > 0, Entrega.km_percorridos), else_=Entrega.distancia_km))
@@ -759,50 +743,21 @@ def _fracao_de_meses(inicio: date, fim: date) -> float:
 
 
 def _minutos_ponto_por_dia(estabelecimento_id, funcionario_ids, dt_inicio, dt_fim, jornada_min):
-    """UMA query de RegistroPonto do período inteiro, processada com a MESMA
-    regra do espelho (pareamento entrada/saída por dia): retorna
-    {(funcionario_id, data): {"extras": int, "atraso": int}} em minutos.
-    Permite incluir horas extras e atrasos no custo agregado da folha sem
-    N+1 (antes o custo agregado simplesmente IGNORAVA extras/atrasos)."""
-    from app.models import RegistroPonto
+    """UMA query no consolidado diário (PontoDiario) do período inteiro, com a
+    MESMA regra do espelho: retorna {(funcionario_id, data): {"extras": int,
+    "atraso": int}} em minutos. Permite incluir horas extras e atrasos no
+    custo agregado da folha sem N+1."""
+    from app.services.ponto_diario_service import PontoDiarioService
 
     if not funcionario_ids:
         return {}
 
-    registros = (RegistroPonto.query
-                 .filter(RegistroPonto.funcionario_id.in_(funcionario_ids),
-                         RegistroPonto.data >= dt_inicio,
-                         RegistroPonto.data <= dt_fim)
-                 .order_by(RegistroPonto.data, RegistroPonto.hora)
-                 .all())
-
-    por_dia = defaultdict(list)
-    for r in registros:
-        por_dia[(r.funcionario_id, r.data)].append(r)
-
     resultado = {}
-    for chave, regs in por_dia.items():
-        entrada = saida = ii = iff = None
-        atraso = 0
-        for r in regs:
-            if r.tipo_registro == "entrada":
-                entrada = r.hora
-                atraso += r.minutos_atraso or 0
-            elif r.tipo_registro == "saida_almoco":
-                ii = r.hora
-                atraso += r.minutos_atraso or 0
-            elif r.tipo_registro == "retorno_almoco":
-                iff = r.hora
-                atraso += r.minutos_atraso or 0
-            elif r.tipo_registro == "saida":
-                saida = r.hora
+    for dia in PontoDiarioService.dias(funcionario_ids, dt_inicio, dt_fim):
         extras = 0
-        if entrada and saida:
-            trabalhado = (datetime.combine(date.min, saida) - datetime.combine(date.min, entrada)).total_seconds() / 60
-            if ii and iff:
-                trabalhado -= (datetime.combine(date.min, iff) - datetime.combine(date.min, ii)).total_seconds() / 60
-            extras = max(0, int(trabalhado - jornada_min))
-        resultado[chave] = {"extras": extras, "atraso": atraso}
+        if dia.primeira_entrada and dia.ultima_saida:
+            extras = max(0, int((dia.minutos_trabalhados or 0) - jornada_min))
+        resultado[(dia.funcionario_id, dia.data)] = {"extras": extras, "atraso": dia.minutos_atraso or 0}
     return resultado
 
 
@@ -0,0 +1,129 @@
+"""
+Servidor SMTP local que só guarda as mensagens recebidas.
+
+Usado nos testes da fila de e-mails e em desenvolvimento (`flask smtp-sink`):
+aceita EHLO/HELO, AUTH PLAIN/LOGIN (qualquer credencial), MAIL, RCPT, DATA,
+RSET, NOOP e QUIT — sem TLS. Cada sessão TCP é contada em `conexoes`, o que
+permite verificar que vários e-mails saíram pela mesma conexão.
+"""
+from __future__ import annotations
+
+import socketserver
+import threading
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from typing import Any, Dict, List
+
+
+class _Sessao(socketserver.StreamRequestHandler):
+
+    def _responder(self, linha: str) -> None:
+        self.wfile.write((linha + "\r\n").encode())
+
+    def handle(self):
+        sink: "SMTPSink" = self.server.sink
+        with sink._lock:
+            sink.conexoes += 1
+        self._responder("220 smtp-sink pronto")
+        remetente, destinatarios = None, []
+        while True:
+            linha = self.rfile.readline()
+            if not linha:
+                return
+            comando = linha.decode(errors="replace").strip()
+            verbo = comando.split(" ", 1)[0].upper()
+            if verbo == "EHLO":
+                self._responder("250-smtp-sink")
+                self._responder("250-AUTH PLAIN LOGIN")
+                self._responder("250 8BITMIME")
+            elif verbo == "HELO":
+                self._responder("250 smtp-sink")
+            elif verbo == "AUTH":
+                partes = comando.split()
+                if partes[1].upper() == "LOGIN":
+                    for pergunta in ("334 VXNlcm5hbWU6", "334 UGFzc3dvcmQ6"):
+                        self._responder(pergunta)
+                        self.rfile.readline()
+                elif len(partes) < 3:
+                    self._responder("334 ")
+                    self.rfile.readline()
+                self._responder("235 Autenticado")
+            elif verbo == "MAIL":
+                remetente, destinatarios = comando.split(":", 1)[1].strip().strip("<>").split(">")[0], []
+                self._responder("250 OK")
+            elif verbo == "RCPT":
+                destino = comando.split(":", 1)[1].strip().strip("<>").split(">")[0]
+                if destino in sink.recusar:
+                    self._responder("550 Caixa postal inexistente")
+                else:
+                    destinatarios.append(destino)
+                    self._responder("250 OK")
+            elif verbo == "DATA":
+                self._responder("354 Termine com <CRLF>.<CRLF>")
+                dados = []
+                while True:
+                    parte = self.rfile.readline()
+                    if not parte or parte in (b".\r\n", b".\n"):
+                        break
+                    dados.append(parte[1:] if parte.startswith(b"..") else parte)
+                sink._guardar(remetente, destinatarios, b"".join(dados))
+                self._responder("250 OK enfileirado")
+            elif verbo in ("RSET", "NOOP"):
+                if verbo == "RSET":
+                    remetente, destinatarios = None, []
+                self._responder("250 OK")
+            elif verbo == "QUIT":
+                self._responder("221 Tchau")
+                return
+            else:
+                self._responder("502 Comando não implementado")
+
+
+class _Servidor(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    """Uso: `with SMTPSink() as sink: ... sink.porta ... sink.mensagens`."""
+
+    def __init__(self, host: str = "127.0.0.1", porta: int = 0):
+        self.host = host
+        self._porta = porta
+        self.mensagens: List[Dict[str, Any]] = []
+        self.conexoes = 0
+        self.recusar: set = set()  # destinatários recusados com 550
+        self._lock = threading.Lock()
+        self._servidor = None
+
+    @property
+    def porta(self) -> int:
+        return self._servidor.server_address[1] if self._servidor else self._porta
+
+    def _guardar(self, remetente, destinatarios, bruto: bytes) -> None:
+        msg = message_from_bytes(bruto)
+        with self._lock:
+            self.mensagens.append({
+                "remetente": remetente,
+                "destinatarios": list(destinatarios),
+                "assunto": str(make_header(decode_header(msg.get("Subject", "")))),
+                "mensagem": msg,
+            })
+
+    def iniciar(self) -> "SMTPSink":
+        self._servidor = _Servidor((self.host, self._porta), _Sessao)
+        self._servidor.sink = self
+        threading.Thread(target=self._servidor.serve_forever, name="smtp-sink", daemon=True).start()
+        return self
+
+    def parar(self) -> None:
+        if self._servidor:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+            self._servidor = None
+
+    def __enter__(self) -> "SMTPSink":
+        return self.iniciar()
+
+    def __exit__(self, *exc) -> None:
+        self.parar()
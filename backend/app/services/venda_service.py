@@ -1,11 +1,18 @@
 """
 Serviço de lógica de vendas
 """
-from app.models import db, Venda, VendaItem, Pagamento, ContaReceber, Produto, MovimentacaoEstoque, Cliente, MovimentacaoCaixa
-from app.utils.errors import EstoqueInsuficienteError, ProdutoNaoEncontradoError, FiadoSemClienteError, PagamentoInvalidoError
+from app.models import (
+    db, Auditoria, Venda, VendaItem, Pagamento, ContaReceber, Produto, ProdutoLote, MovimentacaoEstoque, Cliente,
+    MovimentacaoCaixa, janela_particionada,
+)
+from app.utils.errors import (
+    EstoqueInsuficienteError, ProdutoNaoEncontradoError, FiadoSemClienteError, PagamentoInvalidoError,
+    VendaJaCanceladaError,
+)
 from decimal import Decimal
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any
+from typing import Iterable, List, Dict, Any
+from sqlalchemy import func, select
 
 class VendaService:
     """Serviço de lógica de vendas"""
@@ -228,3 +235,193 @@ class VendaService:
             cliente.total_compras = int(cliente.total_compras or 0) + 1
             cliente.valor_total_gasto = float(cliente.valor_total_gasto or 0) + float(total_venda)
             cliente.ultima_compra = data_venda
+
+    @staticmethod
+    def ids_de_produto(itens: Iterable[Dict]) -> List[int]:
+        """
+        Ids de produto dos itens do checkout (campo id, productId ou produto_id), na ordem.
+
+        Raises:
+            ValueError: item sem id ou com id não numérico — o checkout responde 400
+        """
+        ids = []
+        for item in itens:
+            bruto = item.get("id") or item.get("productId") or item.get("produto_id")
+            try:
+                ids.append(int(bruto))
+            except (TypeError, ValueError):
+                raise ValueError(f"ID de produto inválido: {bruto!r}")
+        return ids
+
+    @staticmethod
+    def travar_produtos(estabelecimento_id: int, produto_ids: Iterable) -> Dict[int, Produto]:
+        """
+        Trava (SELECT ... FOR UPDATE) os produtos informados numa única consulta,
+        em ordem de id.
+
+        Checkout e cancelamento travam pela mesma ordem: duas transações que
+        disputam os mesmos SKUs esperam uma pela outra em vez de se travarem
+        mutuamente (deadlock). populate_existing relê o estoque já travado
+        mesmo que o produto esteja no identity map da sessão.
+
+        Returns:
+            Dict[int, Produto]: produtos encontrados, por id
+
+        Raises:
+            ValueError: id não numérico (validar antes com ids_de_produto)
+        """
+        try:
+            ids = sorted({int(i) for i in produto_ids if i})
+        except (TypeError, ValueError):
+            raise ValueError("ID de produto inválido")
+        if not ids:
+            return {}
+        produtos = (Produto.query
+                    .filter(Produto.estabelecimento_id == estabelecimento_id, Produto.id.in_(ids))
+                    .order_by(Produto.id)
+                    .with_for_update()
+                    .populate_existing()
+                    .all())
+        return {p.id: p for p in produtos}
+
+    @staticmethod
+    def cancelar(venda: Venda, motivo: str, funcionario_id: int, autorizador=None) -> Dict[str, Any]:
+        """
+        Cancela a venda devolvendo estoque e lotes e estornando pagamentos,
+        fiado e métricas do cliente. Não confirma a transação.
+
+        Ordem de travas: a venda (barra dois cancelamentos simultâneos) e
+        depois os produtos em ordem de id (travar_produtos, como no checkout).
+        Itens são somados por produto numa consulta; lotes, pagamentos e
+        cliente são carregados (e travados) numa consulta cada e alterados
+        pelo ORM, para a auditoria e a fila de sincronização acompanharem.
+
+        Args:
+            venda: Venda a cancelar
+            motivo: Motivo informado
+            funcionario_id: Funcionário que registra as movimentações
+            autorizador: Funcionário que autorizou (PIN/senha), se houver
+
+        Returns:
+            Dict: contagens do que foi revertido
+
+        Raises:
+            VendaJaCanceladaError: Se a venda já estava (ou acabou de ser) cancelada
+        """
+        estab_id = venda.estabelecimento_id
+        venda = (Venda.query.filter_by(id=venda.id, estabelecimento_id=estab_id)
+                 .with_for_update().populate_existing().one())
+        if venda.status == "cancelada":
+            raise VendaJaCanceladaError(venda.codigo)
+
+        # 1. Itens somados por produto (a mesma venda pode repetir o SKU)
+        itens = db.session.execute(
+            select(VendaItem.produto_id, func.sum(VendaItem.quantidade), func.sum(VendaItem.total_item))
+            .where(VendaItem.venda_id == venda.id, *janela_particionada(VendaItem, venda.data_venda))
+            .group_by(VendaItem.produto_id)
+        ).all()
+        devolver = {pid: (Decimal(str(qtd or 0)), Decimal(str(total or 0))) for pid, qtd, total in itens}
+
+        # 2. Estoque: uma trava ordenada, contadores e movimentações em lote
+        produtos = VendaService.travar_produtos(estab_id, devolver)
+        lotes_por_produto = {}
+        for produto_id, lote_id, qtd in db.session.execute(
+            select(MovimentacaoEstoque.produto_id, MovimentacaoEstoque.lote_id, func.sum(MovimentacaoEstoque.quantidade))
+            .where(MovimentacaoEstoque.venda_id == venda.id, MovimentacaoEstoque.tipo == "saida",
+                   MovimentacaoEstoque.lote_id.isnot(None))
+            .group_by(MovimentacaoEstoque.produto_id, MovimentacaoEstoque.lote_id)
+        ):
+            lotes_por_produto.setdefault(produto_id, []).append((lote_id, Decimal(str(qtd or 0))))
+
+        movimentacoes = []
+        for produto_id, produto in produtos.items():
+            qtd, total = devolver[produto_id]
+            anterior = Decimal(str(produto.quantidade or 0))
+            produto.quantidade = anterior + qtd
+            # Reverter denormalizações do produto — sem isso, giro/curva ABC/
+            # ranking de mais vendidos ficavam inflados por vendas desfeitas.
+            produto.quantidade_vendida = max(Decimal("0"), Decimal(str(produto.quantidade_vendida or 0)) - qtd)
+            produto.total_vendido = max(Decimal("0"), Decimal(str(produto.total_vendido or 0)) - total)
+            lotes = lotes_por_produto.get(produto_id, [])
+            movimentacoes.append(MovimentacaoEstoque(
+                estabelecimento_id=estab_id,
+                produto_id=produto_id,
+                lote_id=lotes[0][0] if len(lotes) == 1 else None,
+                tipo="entrada",
+                quantidade=qtd,
+                quantidade_anterior=anterior,
+                quantidade_atual=produto.quantidade,
+                motivo=f"Cancelamento da venda #{venda.codigo}"[:100],
+                observacoes=f"Devolução por cancelamento. Motivo: {motivo}",
+                venda_id=venda.id,
+                funcionario_id=funcionario_id,
+            ))
+        db.session.add_all(movimentacoes)
+
+        # Lotes baixados na venda (movimentações com lote_id) voltam ao saldo
+        lotes = sorted(lote for lotes_produto in lotes_por_produto.values() for lote in lotes_produto)
+        if lotes:
+            travados = {lote.id: lote for lote in db.session.execute(
+                select(ProdutoLote).where(ProdutoLote.id.in_([lote_id for lote_id, _ in lotes]))
+                .order_by(ProdutoLote.id).with_for_update().execution_options(populate_existing=True)
+            ).scalars()}
+            for lote_id, qtd in lotes:
+                lote = travados[lote_id]
+                lote.quantidade = Decimal(str(lote.quantidade or 0)) + qtd
+                lote.ativo = True
+
+        # 3. Pagamentos estornados
+        estornados = db.session.execute(
+            select(Pagamento).where(Pagamento.venda_id == venda.id, *janela_particionada(Pagamento, venda.data_venda))
+        ).scalars().all()
+        for pagamento in estornados:
+            pagamento.status = "estornado"
+        pagamentos = len(estornados)
+
+        # 4. Fiado em aberto: via ORM, para o razão financeiro acompanhar
+        contas = ContaReceber.query.filter_by(venda_id=venda.id, status="aberto").all()
+        fiado = sum((Decimal(str(c.valor_atual or 0)) for c in contas), Decimal("0"))
+        for conta in contas:
+            conta.status = "cancelado"
+
+        # 5. Métricas do cliente sobre a linha travada (vendas concorrentes do
+        # mesmo cliente não se sobrescrevem). Sem isso, "melhor cliente" e o
+        # histórico de gasto ficavam inflados com vendas desfeitas.
+        if venda.cliente_id:
+            cliente = db.session.execute(
+                select(Cliente).where(Cliente.id == venda.cliente_id, Cliente.estabelecimento_id == estab_id)
+                .with_for_update().execution_options(populate_existing=True)
+            ).scalar_one_or_none()
+            if cliente is not None:
+                def _abater(valor, menos):
+                    return max(Decimal("0"), Decimal(str(valor or 0)) - menos)
+
+                cliente.valor_total_gasto = _abater(cliente.valor_total_gasto, Decimal(str(venda.total or 0)))
+                cliente.total_compras = max(0, int(cliente.total_compras or 0) - 1)
+                cliente.saldo_devedor = _abater(cliente.saldo_devedor, fiado)
+
+        venda.status = "cancelada"
+        agora = datetime.now()
+        venda.data_cancelamento = agora
+        venda.motivo_cancelamento = (motivo or "")[:255]
+        autorizado_por = f" | Autorizado por: {autorizador.nome}" if autorizador else ""
+        venda.observacoes = (f"{venda.observacoes or ''}\n[Cancelada em {agora.strftime('%d/%m/%Y %H:%M')}] "
+                             f"Motivo: {motivo}{autorizado_por}").strip()
+        venda.updated_at = agora
+
+        Auditoria.registrar(
+            estabelecimento_id=estab_id,
+            tipo_evento="venda_cancelada",
+            descricao=f"Venda {venda.codigo} cancelada — {motivo}" + (
+                f" (autorizado por {autorizador.nome})" if autorizador else ""
+            ),
+            usuario_id=autorizador.id if autorizador else funcionario_id,
+            valor=float(venda.total or 0),
+        )
+        return {
+            "produtos": len(produtos),
+            "quantidade_devolvida": float(sum((q for q, _ in devolver.values()), Decimal("0"))),
+            "lotes": len(lotes),
+            "pagamentos_estornados": pagamentos,
+            "contas_canceladas": len(contas),
+        }
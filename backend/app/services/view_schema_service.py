@@ -17,9 +17,22 @@ A resolução é uma cascata de 3 níveis:
 
 Nada de "if validade" hardcoded em tela: quem quiser saber se validade existe
 pergunta ao schema.
+
+Compilação: o schema resolvido vira um artefato imutável (JSON canônico +
+ETag sha256) guardado no cache compartilhado da aplicação. A chave carrega
+carimbos de versão — do catálogo em código, do view_registry e do tenant — e
+o hash do segmento/configurações da loja; invalidar é só trocar um carimbo,
+o que vale para todos os workers que leem o mesmo cache. Cada processo ainda
+mantém os últimos artefatos desserializados em memória (LRU), endereçados pela
+mesma chave, então um hit custa uma leitura de dois carimbos.
 """
+import hashlib
 import json
-import time
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from typing import NamedTuple
 
 from app import db
 from app.models import Estabelecimento, ViewRegistry
@@ -420,19 +433,63 @@ METRICAS_PADRAO = [
      "tema": "amber", "segmentos": ["mercearia", "generico"], "ordem": 120},
 ]
 
-# Cache leve do schema resolvido (o registry muda raramente; overrides invalidam).
-_CACHE_TTL_SEGUNDOS = 60
-_schema_cache = {}
+logger = logging.getLogger(__name__)
+
+# Artefatos compilados: cache compartilhado (TTL longo, a chave é versionada)
+# + LRU por processo com o dict já desserializado.
+_TTL_ARTEFATO = 7 * 24 * 3600
+_MAX_ARTEFATOS_LOCAIS = 256
+_artefatos: "OrderedDict[str, ArtefatoSchema]" = OrderedDict()
+_artefatos_por_id = {}  # id(schema) -> artefato, p/ sanitizar_atributos achar os índices
+_artefatos_lock = threading.Lock()
+_CHAVE_VERSAO_REGISTRY = "view_schema:versao:registry"
+
+
+def _impressao(*partes) -> str:
+    bruto = json.dumps(partes, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()[:16]
+
+
+class ArtefatoSchema(NamedTuple):
+    """Schema compilado. `schema` é compartilhado entre requisições: não mutar."""
+    schema: dict
+    json: str
+    etag: str
+    atributos_por_tipo: dict
+
+
+def _cache():
+    from app import cache
+    return cache
+
+
+def _chave_versao_tenant(estabelecimento_id) -> str:
+    return f"view_schema:versao:tenant:{int(estabelecimento_id)}"
 
 
 def invalidar_cache_view_schema(estabelecimento_id=None):
-    if estabelecimento_id is None:
-        _schema_cache.clear()
-    else:
-        estabelecimento_id = int(estabelecimento_id)
-        chaves = [chave for chave in _schema_cache if isinstance(chave, tuple) and chave[0] == estabelecimento_id]
-        for chave in chaves:
-            _schema_cache.pop(chave, None)
+    """Troca o carimbo de versão (do tenant ou do registry global): as chaves
+    antigas deixam de ser lidas em todos os workers e expiram sozinhas."""
+    chave = _CHAVE_VERSAO_REGISTRY if estabelecimento_id is None else _chave_versao_tenant(estabelecimento_id)
+    try:
+        _cache().set(chave, uuid.uuid4().hex[:12], timeout=0)
+    except Exception as e:
+        logger.warning(f"View schema: cache indisponível ao invalidar ({e})")
+        with _artefatos_lock:
+            _artefatos.clear()
+            _artefatos_por_id.clear()
+
+
+def _versoes(*chaves) -> list:
+    cache = _cache()
+    versoes = list(cache.get_many(*chaves))
+    for i, (chave, versao) in enumerate(zip(chaves, versoes)):
+        if versao is None:
+            cache.add(chave, uuid.uuid4().hex[:12], timeout=0)  # add: não sobrescreve outro worker
+            versoes[i] = cache.get(chave)
+            if versoes[i] is None:  # cache que não guarda nada: sem carimbo não há como invalidar
+                raise RuntimeError("carimbo de versão não persistiu")
+    return versoes
 
 
 def garantir_registry_seed():
@@ -657,6 +714,13 @@ def _linha_vale_para(linha: ViewRegistry, segmento: str, habilitados: set, ocult
     return "*" in segmentos or segmento in segmentos
 
 
+# Impressão digital do catálogo em código: um deploy que mexe em campos,
+# métricas, segmentos, famílias ou sugestões fiscais muda a chave de todos os
+# artefatos.
+_VERSAO_CATALOGO = _impressao(SEGMENTOS, FAMILIAS_PRODUTO, MIX_PADRAO_POR_SEGMENTO, CAMPOS_PADRAO,
+                              METRICAS_PADRAO, PERFIL_FISCAL_PADRAO_POR_FAMILIA, FISCAL_SUGERIDO_POR_FAMILIA)
+
+
 def resolver_view_schema(
     estabelecimento: Estabelecimento = None,
     segmento: str = None,
@@ -666,16 +730,77 @@ def resolver_view_schema(
     """
     Resolve a cascata Global → Tenant e devolve o View Schema pronto p/ renderizar.
     Sem estabelecimento (ex.: super admin na visão 'all'), resolve só o nível
-    Global para o segmento informado, sem overrides e sem cache.
+    Global para o segmento informado, sem overrides.
     """
-    cache_key = None
+    return compilar_view_schema(estabelecimento, segmento, familia_produto, tipo_item).schema
+
+
+def compilar_view_schema(
+    estabelecimento: Estabelecimento = None,
+    segmento: str = None,
+    familia_produto: str = None,
+    tipo_item: str = "produto",
+) -> ArtefatoSchema:
+    """Artefato compilado (schema + JSON + ETag) da resolução; ver docstring do módulo."""
+    try:
+        chave = _chave_artefato(estabelecimento, segmento, familia_produto, tipo_item)
+    except Exception as e:
+        logger.warning(f"View schema: cache indisponível ({e}); resolvendo sem cache.")
+        return _artefato(_montar_view_schema(estabelecimento, segmento, familia_produto, tipo_item))
+
+    with _artefatos_lock:
+        artefato = _artefatos.get(chave)
+        if artefato is not None:
+            _artefatos.move_to_end(chave)
+            return artefato
+
+    compartilhado = _cache().get(chave)
+    if compartilhado:
+        artefato = _artefato(json.loads(compartilhado["json"]), compartilhado["json"], compartilhado["etag"])
+    else:
+        artefato = _artefato(_montar_view_schema(estabelecimento, segmento, familia_produto, tipo_item))
+        # A montagem pode ter semeado o registry (e trocado o carimbo global):
+        # guarda sob a chave da versão que de fato foi lida.
+        chave = _chave_artefato(estabelecimento, segmento, familia_produto, tipo_item)
+        _cache().set(chave, {"json": artefato.json, "etag": artefato.etag}, timeout=_TTL_ARTEFATO)
+
+    with _artefatos_lock:
+        _artefatos[chave] = artefato
+        _artefatos_por_id[id(artefato.schema)] = artefato
+        while len(_artefatos) > _MAX_ARTEFATOS_LOCAIS:
+            _, antigo = _artefatos.popitem(last=False)
+            _artefatos_por_id.pop(id(antigo.schema), None)
+    return artefato
+
+
+def _chave_artefato(estabelecimento, segmento, familia_produto, tipo_item) -> str:
+    familia_chave = str(familia_produto or "").lower().strip()
+    tipo_chave = str(tipo_item or "produto").lower()
     if estabelecimento is not None:
-        cache_key = (int(estabelecimento.id), str(familia_produto or "").lower().strip(), str(tipo_item or "produto").lower())
-    if cache_key is not None:
-        em_cache = _schema_cache.get(cache_key)
-        if em_cache and (time.time() - em_cache[0]) < _CACHE_TTL_SEGUNDOS:
-            return em_cache[1]
+        versao_registry, versao_tenant = _versoes(_CHAVE_VERSAO_REGISTRY, _chave_versao_tenant(estabelecimento.id))
+        contexto = _impressao(estabelecimento.segmento, estabelecimento.configuracoes_json)
+        return (f"view_schema:{_VERSAO_CATALOGO}:{versao_registry}:t{int(estabelecimento.id)}:"
+                f"{versao_tenant}:{contexto}:{familia_chave}:{tipo_chave}")
+    versao_registry, = _versoes(_CHAVE_VERSAO_REGISTRY)
+    return (f"view_schema:{_VERSAO_CATALOGO}:{versao_registry}:s:"
+            f"{normalizar_segmento(segmento)}:{familia_chave}:{tipo_chave}")
+
+
+def _artefato(schema: dict, bruto: str = None, etag: str = None) -> ArtefatoSchema:
+    if bruto is None:
+        bruto = json.dumps(schema, ensure_ascii=False, separators=(",", ":"))
+        etag = hashlib.sha256(bruto.encode("utf-8")).hexdigest()[:32]
+    return ArtefatoSchema(schema, bruto, etag, {
+        tipo: _indexar_campos_de_atributo(schema, tipo) for tipo in ("produto", "servico")
+    })
 
+
+def _montar_view_schema(
+    estabelecimento: Estabelecimento = None,
+    segmento: str = None,
+    familia_produto: str = None,
+    tipo_item: str = "produto",
+) -> dict:
     garantir_registry_seed()
 
     if estabelecimento is not None:
@@ -777,13 +902,18 @@ def resolver_view_schema(
         ],
     }
 
-    if cache_key is not None:
-        _schema_cache[cache_key] = (time.time(), schema)
     return schema
 
 
 def campos_de_atributo(schema: dict, tipo_item: str = "produto") -> dict:
     """Campos de origem 'atributo' aplicáveis ao tipo de item, indexados por chave."""
+    artefato = _artefatos_por_id.get(id(schema))
+    if artefato is not None and artefato.schema is schema and tipo_item in artefato.atributos_por_tipo:
+        return artefato.atributos_por_tipo[tipo_item]
+    return _indexar_campos_de_atributo(schema, tipo_item)
+
+
+def _indexar_campos_de_atributo(schema: dict, tipo_item: str) -> dict:
     resultado = {}
     for campo in schema.get("campos", []):
         if campo.get("origem") != "atributo":
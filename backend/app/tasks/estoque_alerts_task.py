@@ -1,71 +1,84 @@
+"""
+Rotina agendada de alertas de estoque e validade.
+
+Roda o motor incremental (EstoqueAlertasService) para TODAS as lojas em uma
+passada e dispara as notificações em lote por loja. Pode ser chamada por cron
+(`flask verificar-alertas-estoque`) ou pela thread agendadora iniciada no boot.
+
+A thread só roda quando ESTOQUE_ALERTAS_AUTO != "false" e fora de TESTING.
+"""
 import logging
-from datetime import datetime, timedelta
-from app.models import db, Produto, Estabelecimento
-from app.services.email_service import notificar_estoque_baixo, notificar_vencimento_proximo
+import os
+import threading
+import time
+
+from app.models import allow_all_tenants
+from app.services.estoque_alertas_service import EstoqueAlertasService
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_INTERVAL = int(os.getenv("ESTOQUE_ALERTAS_INTERVAL_SEC", "3600"))  # 1 h
+
+
 class EstoqueAlertsTask:
     """
-    Serviço para verificar e alertar sobre:
+    Verifica e alerta sobre:
     - Ruptura de Estoque (Estoque Mínimo)
-    - Vencimento de Produtos Próximo (30 dias ou definido no produto)
+    - Lotes vencidos / vencendo (dias_alerta_validade da loja)
+    - Produtos parados (sem venda há 180 dias)
     """
 
     @staticmethod
-    def run_daily_checks(app):
+    def run_daily_checks(app, notificar: bool = True):
         """
-        Executa as verificações de estoque.
-        Deve ser chamado por um cronjob diário ou APScheduler.
+        Executa as verificações de estoque de todas as lojas.
+
+        Returns:
+            {"sincronizados": {estab_id: {novos, ativos, resolvidos}}, "notificados": {estab_id: n}}
         """
         with app.app_context():
             logger.info("Iniciando rotina de verificação de estoque e validade...")
-            
-            # Buscar todos os estabelecimentos
-            estabelecimentos = Estabelecimento.query.all()
-            
-            for estab in estabelecimentos:
-                logger.info(f"Verificando estabelecimento {estab.nome_fantasia} (ID: {estab.id})")
-                
-                # 1. Ruptura de Estoque (Abaixo do mínimo)
-                produtos_ruptura = Produto.query.filter(
-                    Produto.estabelecimento_id == estab.id,
-                    Produto.ativo == True,
-                    Produto.quantidade <= Produto.estoque_minimo
-                ).all()
-                
-                if produtos_ruptura:
-                    logger.info(f"Encontrados {len(produtos_ruptura)} produtos em ruptura/baixo estoque.")
-                    # Na vida real, enviamos push notification, email ou populamos a tabela de alertas
-                    # notificar_estoque_baixo(estab, produtos_ruptura)
-                    
-                # 2. Vencimento Próximo
-                hoje = datetime.now().date()
-                dias_alerta = 30 # Default 30 dias para vencer
-                data_limite = hoje + timedelta(days=dias_alerta)
-                
-                produtos_vencimento = Produto.query.filter(
-                    Produto.estabelecimento_id == estab.id,
-                    Produto.ativo == True,
-                    Produto.data_validade != None,
-                    Produto.data_validade <= data_limite,
-                    Produto.data_validade >= hoje
-                ).all()
-                
-                if produtos_vencimento:
-                    logger.info(f"Encontrados {len(produtos_vencimento)} produtos vencendo nos próximos {dias_alerta} dias.")
-                    # notificar_vencimento_proximo(estab, produtos_vencimento)
-                    
-                # 3. Produtos Vencidos
-                produtos_vencidos = Produto.query.filter(
-                    Produto.estabelecimento_id == estab.id,
-                    Produto.ativo == True,
-                    Produto.data_validade != None,
-                    Produto.data_validade < hoje
-                ).all()
-                
-                if produtos_vencidos:
-                     logger.warning(f"Encontrados {len(produtos_vencidos)} produtos VENCIDOS.")
-                     
-            logger.info("Rotina de verificação finalizada com sucesso.")
-            return True
+            with allow_all_tenants():
+                resumo = EstoqueAlertasService.sincronizar()
+                notificados = EstoqueAlertasService.notificar_pendentes() if notificar else {}
+            novos = sum(r["novos"] for r in resumo.values())
+            resolvidos = sum(r["resolvidos"] for r in resumo.values())
+            logger.info(
+                f"Rotina de verificação finalizada: {novos} novo(s), {resolvidos} resolvido(s), "
+                f"{len(notificados)} loja(s) notificada(s)."
+            )
+            return {"sincronizados": resumo, "notificados": notificados}
+
+
+class EstoqueAlertsScheduler(threading.Thread):
+    def __init__(self, app, interval_sec: int = DEFAULT_INTERVAL):
+        super().__init__()
+        self.app = app
+        self.daemon = True
+        self.interval = interval_sec
+
+    def _deve_rodar(self) -> bool:
+        if os.getenv("ESTOQUE_ALERTAS_AUTO", "true").lower() == "false":
+            return False
+        return not self.app.config.get("TESTING")
+
+    def run(self):
+        self.app.logger.info(f"[ALERTAS ESTOQUE] Agendador iniciado (intervalo {self.interval}s).")
+        # Espera inicial para não competir com o boot
+        time.sleep(min(120, self.interval))
+        while True:
+            try:
+                EstoqueAlertsTask.run_daily_checks(self.app)
+            except Exception as e:
+                self.app.logger.error(f"[ALERTAS ESTOQUE] Erro no ciclo: {e}")
+            time.sleep(self.interval)
+
+
+def start_estoque_alerts_scheduler(app):
+    """Inicia o agendador se as condições forem atendidas. Retorna a thread ou None."""
+    scheduler = EstoqueAlertsScheduler(app)
+    if not scheduler._deve_rodar():
+        app.logger.info("[ALERTAS ESTOQUE] Agendador NÃO iniciado (desabilitado).")
+        return None
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,70 @@
+"""
+Rotina agendada de acerto do razão financeiro mensal (financeiro_mensal).
+
+O razão é mantido por deltas a cada flush do ORM; escritas fora dele (UPDATE
+em massa, SQL manual, importações) são corrigidas aqui: os meses recentes de
+cada loja são recomputados das tabelas de origem e as divergências regravadas
+(FinanceiroMensalService.reconciliar_recentes). Pode ser chamada por cron
+(`flask reconciliar-financeiro`) ou pela thread agendadora iniciada no boot.
+
+A thread só roda quando FINANCEIRO_RECONCILIACAO_AUTO != "false" e fora de
+TESTING.
+"""
+import logging
+import os
+import threading
+import time
+
+from app.services.financeiro_mensal_service import FinanceiroMensalService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = int(os.getenv("FINANCEIRO_RECONCILIACAO_INTERVAL_SEC", "86400"))  # 1 dia
+DEFAULT_MESES = int(os.getenv("FINANCEIRO_RECONCILIACAO_MESES", "2"))
+
+
+class FinanceiroTask:
+    """Recompõe os meses recentes do razão financeiro de todas as lojas."""
+
+    @staticmethod
+    def run(app, meses: int = None):
+        with app.app_context():
+            resumo = FinanceiroMensalService.reconciliar_recentes(meses or DEFAULT_MESES)
+            divergentes = [estab_id for estab_id, r in resumo.items() if not r["consistente"]]
+            logger.info(f"[FINANCEIRO] Razão conferido em {len(resumo)} loja(s).")
+            if divergentes:
+                logger.warning(f"[FINANCEIRO] Divergências corrigidas nas lojas: {divergentes}")
+            return resumo
+
+
+class FinanceiroScheduler(threading.Thread):
+    def __init__(self, app, interval_sec: int = DEFAULT_INTERVAL):
+        super().__init__()
+        self.app = app
+        self.daemon = True
+        self.interval = interval_sec
+
+    def _deve_rodar(self) -> bool:
+        if os.getenv("FINANCEIRO_RECONCILIACAO_AUTO", "true").lower() == "false":
+            return False
+        return not self.app.config.get("TESTING")
+
+    def run(self):
+        self.app.logger.info(f"[FINANCEIRO] Agendador iniciado (intervalo {self.interval}s).")
+        time.sleep(min(600, self.interval))
+        while True:
+            try:
+                FinanceiroTask.run(self.app)
+            except Exception as e:
+                self.app.logger.error(f"[FINANCEIRO] Erro no ciclo: {e}")
+            time.sleep(self.interval)
+
+
+def start_financeiro_scheduler(app):
+    """Inicia o agendador se as condições forem atendidas. Retorna a thread ou None."""
+    scheduler = FinanceiroScheduler(app)
+    if not scheduler._deve_rodar():
+        app.logger.info("[FINANCEIRO] Agendador NÃO iniciado (desabilitado ou em teste).")
+        return None
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,71 @@
+"""
+Rotina agendada de manutenção das partições mensais (Postgres).
+
+Cria com antecedência as partições dos próximos meses das tabelas já
+convertidas (ParticionamentoService.manter), para nenhuma venda cair na
+partição padrão. Pode ser chamada por cron (`flask manter-particoes`) ou pela
+thread agendadora iniciada no boot.
+
+A thread só roda quando PARTICOES_AUTO != "false", fora de TESTING e com o
+banco em Postgres.
+"""
+import logging
+import os
+import threading
+import time
+
+from app.services.particionamento_service import ParticionamentoService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = int(os.getenv("PARTICOES_INTERVAL_SEC", "86400"))  # 1 dia
+
+
+class ParticoesTask:
+    """Garante as partições futuras de vendas, itens, pagamentos e movimentações."""
+
+    @staticmethod
+    def run(app, meses_a_frente: int = None):
+        with app.app_context():
+            resumo = ParticionamentoService.manter(meses_a_frente)
+            criadas = sum(len(r["criadas"]) for r in resumo.values())
+            falhas = [nome for r in resumo.values() for nome in r["falhas"]]
+            logger.info(f"[PARTIÇÕES] Manutenção: {criadas} criada(s) em {len(resumo)} tabela(s).")
+            if falhas:
+                logger.warning(f"[PARTIÇÕES] Não criadas (partição padrão com linhas do mês?): {falhas}")
+            return resumo
+
+
+class ParticoesScheduler(threading.Thread):
+    def __init__(self, app, interval_sec: int = DEFAULT_INTERVAL):
+        super().__init__()
+        self.app = app
+        self.daemon = True
+        self.interval = interval_sec
+
+    def _deve_rodar(self) -> bool:
+        if os.getenv("PARTICOES_AUTO", "true").lower() == "false":
+            return False
+        if self.app.config.get("TESTING"):
+            return False
+        return "postgres" in str(self.app.config.get("SQLALCHEMY_DATABASE_URI", ""))
+
+    def run(self):
+        self.app.logger.info(f"[PARTIÇÕES] Agendador iniciado (intervalo {self.interval}s).")
+        time.sleep(min(300, self.interval))
+        while True:
+            try:
+                ParticoesTask.run(self.app)
+            except Exception as e:
+                self.app.logger.error(f"[PARTIÇÕES] Erro no ciclo: {e}")
+            time.sleep(self.interval)
+
+
+def start_particoes_scheduler(app):
+    """Inicia o agendador se as condições forem atendidas. Retorna a thread ou None."""
+    scheduler = ParticoesScheduler(app)
+    if not scheduler._deve_rodar():
+        app.logger.info("[PARTIÇÕES] Agendador NÃO iniciado (desabilitado ou sem Postgres).")
+        return None
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,64 @@
+"""
+Rotina agendada de recálculo dos scores RFM (clientes_rfm).
+
+Recalcula TODAS as lojas em uma passada (RFMService.recalcular_todos) na janela
+padrão; as telas só leem o snapshot. Pode ser chamada por cron
+(`flask recalcular-rfm`) ou pela thread agendadora iniciada no boot.
+
+A thread só roda quando RFM_RECALCULO_AUTO != "false" e fora de TESTING.
+"""
+import logging
+import os
+import threading
+import time
+
+from app.services.rfm_service import RFMService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = int(os.getenv("RFM_RECALCULO_INTERVAL_SEC", str(RFMService.VALIDADE_HORAS * 3600)))
+
+
+class RFMTask:
+    """Regrava o snapshot RFM de todas as lojas."""
+
+    @staticmethod
+    def run(app, janela_dias: int = RFMService.JANELA_DIAS) -> int:
+        with app.app_context():
+            total = RFMService.recalcular_todos(janela_dias=janela_dias)
+            logger.info(f"[RFM] {total} clientes pontuados (janela {janela_dias} dias).")
+            return total
+
+
+class RFMScheduler(threading.Thread):
+    def __init__(self, app, interval_sec: int = DEFAULT_INTERVAL):
+        super().__init__()
+        self.app = app
+        self.daemon = True
+        self.interval = interval_sec
+
+    def _deve_rodar(self) -> bool:
+        if os.getenv("RFM_RECALCULO_AUTO", "true").lower() == "false":
+            return False
+        return not self.app.config.get("TESTING")
+
+    def run(self):
+        self.app.logger.info(f"[RFM] Agendador iniciado (intervalo {self.interval}s).")
+        # Espera inicial para não competir com o boot
+        time.sleep(min(300, self.interval))
+        while True:
+            try:
+                RFMTask.run(self.app)
+            except Exception as e:
+                self.app.logger.error(f"[RFM] Erro no ciclo: {e}")
+            time.sleep(self.interval)
+
+
+def start_rfm_scheduler(app):
+    """Inicia o agendador se as condições forem atendidas. Retorna a thread ou None."""
+    scheduler = RFMScheduler(app)
+    if not scheduler._deve_rodar():
+        app.logger.info("[RFM] Agendador NÃO iniciado (desabilitado ou em teste).")
+        return None
+    scheduler.start()
+    return scheduler
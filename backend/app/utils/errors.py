@@ -76,3 +76,13 @@ class FiadoSemClienteError(APIError):
             message="Para vender no FIADO é obrigatório selecionar um cliente cadastrado.",
             status_code=400
         )
+
+class VendaJaCanceladaError(APIError):
+    """Erro quando a venda já foi cancelada (inclusive por outro terminal)"""
+    def __init__(self, codigo_venda: str):
+        super().__init__(
+            code="VENDA_JA_CANCELADA",
+            message="Esta venda já está cancelada",
+            status_code=400,
+            details={"codigo": codigo_venda}
+        )
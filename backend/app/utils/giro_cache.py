@@ -42,10 +42,14 @@ def get_vendas_agregadas(estabelecimento_id) -> dict:
     if hit and (now - hit[0]) < _TTL_SEGUNDOS:
         return hit[1]
 
-    from app.models import db, Venda, VendaItem, utcnow
+    from app.models import db, Venda, VendaItem, janela_particionada, utcnow
     from sqlalchemy import func
 
-    data_inicio = utcnow() - timedelta(days=GIRO_PERIODO_DIAS)
+    # Janela fechada [início, agora]: com os dois limites o planner estima a
+    # faixa e parte do índice (estabelecimento, data, status) das vendas, em vez
+    # de varrer venda_itens inteira pela ordem do GROUP BY.
+    agora = utcnow()
+    data_inicio = agora - timedelta(days=GIRO_PERIODO_DIAS)
     rows = (
         db.session.query(
             VendaItem.produto_id,
@@ -58,7 +62,8 @@ def get_vendas_agregadas(estabelecimento_id) -> dict:
         .filter(
             Venda.estabelecimento_id == key,
             func.lower(func.coalesce(Venda.status, "")) != "cancelada",
-            Venda.data_venda >= data_inicio,
+            *janela_particionada(Venda, data_inicio, agora),
+            *janela_particionada(VendaItem, data_inicio),
         )
         .group_by(VendaItem.produto_id)
         .all()
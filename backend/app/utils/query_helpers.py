@@ -4,7 +4,11 @@ import traceback
 import unicodedata
 from flask import request
 from flask_jwt_extended import get_jwt
-from sqlalchemy import func, extract, text
+import calendar
+import re
+from datetime import date, timedelta
+
+from sqlalchemy import Date, DateTime, and_, func, extract, text, true
 
 logger = logging.getLogger(__name__)
 
@@ -106,6 +110,103 @@ def get_month_extract(column):
         return func.cast(func.strftime('%m', column), db.Integer)
     return func.cast(extract('month', column), db.Integer)
 
+def filtro_periodo(column, inicio=None, fim=None):
+    """
+    Predicado sargável para "``column`` cai nos dias inicio..fim (inclusive)".
+
+    Substitui ``func.date(column) >= / <= / ==`` e ``EXTRACT(...) = ...``:
+    a coluna fica nua numa faixa semiaberto [de, ate), então o índice
+    composto (estabelecimento_id, data, status) é usado. Colunas DateTime
+    (UTC naive) recebem os limites do dia LOCAL da loja (timezone.intervalo_utc);
+    colunas Date comparam com a própria data. None = sem limite daquele lado.
+    """
+    from app.utils.timezone import como_dia, intervalo_utc
+
+    if isinstance(column.type, Date) and not isinstance(column.type, DateTime):
+        de = como_dia(inicio) if inicio is not None else None
+        ate = como_dia(fim) + timedelta(days=1) if fim is not None else None
+    else:
+        de, ate = intervalo_utc(inicio, fim)
+    predicados = []
+    if de is not None:
+        predicados.append(column >= de)
+    if ate is not None:
+        predicados.append(column < ate)
+    return and_(*predicados) if predicados else true()
+
+
+def filtro_mes(column, ano, mes):
+    """Forma sargável de ``EXTRACT(year) = ano AND EXTRACT(month) = mes``."""
+    return filtro_periodo(column, date(ano, mes, 1), date(ano, mes, calendar.monthrange(ano, mes)[1]))
+
+
+_RE_PLANO_SQLITE = re.compile(
+    r"^(SCAN|SEARCH) (\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+)| USING (INTEGER PRIMARY KEY))?"
+    r"(?: \((.*)\))?")
+_RE_PLANO_PG = re.compile(
+    r"(Seq Scan) on (\w+)|(?:Index|Index Only) Scan(?: Backward)? using (\w+) on (\w+)"
+    r"|Bitmap Heap Scan on (\w+)|Bitmap Index Scan on (\w+)")
+
+
+def acessos_do_plano(sql, params=None, connection=None):
+    """
+    [(tabela, índice, colunas)] de cada acesso a tabela no plano de ``sql``.
+
+    índice None = varredura completa ("SCAN tabela" no SQLite — inclusive SCAN
+    percorrendo um índice inteiro —, "Seq Scan" no Postgres). colunas são as
+    colunas do índice restringidas pela busca (SQLite; None no Postgres):
+    ``("estabelecimento_id",)`` quer dizer que só o tenant filtrou e o período
+    ficou de fora do índice.
+
+    No Postgres o EXPLAIN roda com enable_seqscan desligado: em tabela pequena
+    o planner prefere varrer, mas se nem assim escolhe um índice é porque
+    nenhum atende o predicado. Base dos testes de plano das consultas quentes
+    (tests/test_planos_consulta.py).
+    """
+    conn = connection or _get_db().session.connection()
+    params = params or {}
+    acessos = []
+    if conn.dialect.name == "sqlite":
+        for linha in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params):
+            m = _RE_PLANO_SQLITE.match(str(linha[-1]).strip())
+            if not m:
+                continue
+            if m.group(1) == "SCAN":
+                acessos.append((m.group(2), None, ()))
+                continue
+            colunas = tuple(re.findall(r"(\w+)[=<>]", m.group(5) or ""))
+            acessos.append((m.group(2), m.group(3) or "pk", tuple(dict.fromkeys(colunas))))
+        return acessos
+    savepoint = conn.begin_nested()  # desfeito no fim: o SET LOCAL não vaza para a transação
+    try:
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        plano = [str(linha[0]) for linha in conn.exec_driver_sql("EXPLAIN " + sql, params)]
+    finally:
+        savepoint.rollback()
+    heap = None
+    for linha in plano:
+        for seq, tabela, indice, tabela_ix, heap_tabela, bitmap_ix in _RE_PLANO_PG.findall(linha):
+            if seq:
+                acessos.append((tabela, None, ()))
+            elif indice:
+                acessos.append((tabela_ix, indice, None))
+            elif heap_tabela:
+                heap = heap_tabela
+            elif bitmap_ix and heap:
+                acessos.append((heap, bitmap_ix, None))
+    return acessos
+
+def get_string_agg(column, separator=", "):
+    """
+    Returns the dialect-specific string aggregation (concatena os valores do grupo).
+    PostgreSQL: string_agg | SQLite: group_concat
+    """
+    db = _get_db()
+    engine_name = db.engine.name
+    if engine_name == 'sqlite':
+        return func.group_concat(column, separator)
+    return func.string_agg(column, separator)
+
 def get_estabelecimento_safe(estab_id):
     """
     Busca o estabelecimento via SQL direto, evitando colunas ausentes.
@@ -62,3 +62,29 @@ def local_date_to_utc_naive(date_or_str, fim_do_dia=False):
         dt_local = dt_local.replace(hour=23, minute=59, second=59, microsecond=999999)
     aware_local = dt_local.replace(tzinfo=LOCAL_TZ)
     return aware_local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def como_dia(valor):
+    """date de um date, datetime ou 'YYYY-MM-DD' (parte da hora ignorada)."""
+    if isinstance(valor, str):
+        return datetime.strptime(valor.strip().split("T")[0], "%Y-%m-%d").date()
+    return valor.date() if isinstance(valor, datetime) else valor
+
+
+def hoje_local():
+    """Data de hoje no fuso da loja (não a do servidor, que costuma estar em UTC)."""
+    return datetime.now(LOCAL_TZ).date()
+
+
+def intervalo_utc(inicio=None, fim=None):
+    """
+    Intervalo semiaberto [de, ate) em UTC naive que cobre os dias LOCAIS
+    ``inicio``..``fim`` (inclusive; date, datetime ou 'YYYY-MM-DD'). Qualquer
+    ponta pode ser None (sem limite daquele lado).
+
+    É a forma sargável de "func.date(coluna) entre inicio e fim": a coluna
+    fica nua na comparação e o índice (estabelecimento_id, data, ...) atende.
+    """
+    de = local_date_to_utc_naive(como_dia(inicio)) if inicio is not None else None
+    ate = local_date_to_utc_naive(como_dia(fim) + timedelta(days=1)) if fim is not None else None
+    return de, ate
@@ -81,6 +81,9 @@ class Config:
 
     SECRET_KEY = _secret_key
     JWT_SECRET_KEY = _jwt_secret
+    # Pepper do HMAC de busca do PIN de segurança (app.services.pin_service). Fica
+    # fora do banco: sem ele um dump não permite testar os 10^6 PINs offline.
+    PIN_PEPPER = os.environ.get("PIN_PEPPER")
 
     SQLALCHEMY_DATABASE_URI = _sqlalchemy_database_uri
     USING_POSTGRES = _using_postgres
@@ -0,0 +1,43 @@
+"""financeiro_mensal: razão financeiro mensal por loja, rubrica e categoria
+
+Revision ID: a2c4e6f8b0d1
+Revises: f1b3d5e7a9c2
+Create Date: 2026-10-19
+
+Sem backfill aqui: o mês das vendas depende do fuso da loja e a folha é
+calculada em Python. O razão de cada loja é reconstruído na primeira leitura
+(FinanceiroMensalService.garantir) ou com `flask reconciliar-financeiro --tudo`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "a2c4e6f8b0d1"
+down_revision = "f1b3d5e7a9c2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "financeiro_mensal" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "financeiro_mensal",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+        sa.Column("competencia", sa.Date(), nullable=False),
+        sa.Column("rubrica", sa.String(length=30), nullable=False),
+        sa.Column("categoria", sa.String(length=50), nullable=False),
+        sa.Column("valor", sa.Numeric(19, 4), nullable=False),
+        sa.Column("quantidade", sa.Integer(), nullable=False),
+        sa.Column("atualizado_em", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_financeiro_mensal_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_financeiro_mensal")),
+        sa.UniqueConstraint("estabelecimento_id", "competencia", "rubrica", "categoria", name="uq_financeiro_mensal_chave"),
+    )
+    op.create_index("ix_financeiro_mensal_estabelecimento_id", "financeiro_mensal", ["estabelecimento_id"])
+
+
+def downgrade():
+    op.drop_index("ix_financeiro_mensal_estabelecimento_id", table_name="financeiro_mensal")
+    op.drop_table("financeiro_mensal")
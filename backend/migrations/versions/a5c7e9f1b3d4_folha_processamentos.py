@@ -0,0 +1,75 @@
+"""folha_processamentos: snapshots imutáveis do processamento da folha
+
+Revision ID: a5c7e9f1b3d4
+Revises: f4b6d8e0a2c3
+Create Date: 2026-10-19
+
+Um processamento por (loja, mês, versão) com uma linha por funcionário
+(holerite, provisões e retrospectiva já calculados + hash das entradas).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "a5c7e9f1b3d4"
+down_revision = "f4b6d8e0a2c3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    tabelas = sa.inspect(op.get_bind()).get_table_names()
+    if "folha_processamentos" not in tabelas:
+        op.create_table(
+            "folha_processamentos",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+            sa.Column("mes_referencia", sa.String(length=7), nullable=False),
+            sa.Column("versao", sa.Integer(), nullable=False),
+            sa.Column("criado_por_id", sa.Integer(), nullable=True),
+            sa.Column("criado_em", sa.DateTime(), nullable=True),
+            sa.Column("funcionarios", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("recalculados", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("total_vencimentos", sa.Numeric(19, 4), nullable=True),
+            sa.Column("total_descontos", sa.Numeric(19, 4), nullable=True),
+            sa.Column("total_liquido", sa.Numeric(19, 4), nullable=True),
+            sa.Column("total_custo_real", sa.Numeric(19, 4), nullable=True),
+            sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_folha_processamentos_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+            sa.ForeignKeyConstraint(["criado_por_id"], ["funcionarios.id"], name=op.f("fk_folha_processamentos_criado_por_id_funcionarios"), ondelete="SET NULL"),
+            sa.PrimaryKeyConstraint("id", name=op.f("pk_folha_processamentos")),
+            sa.UniqueConstraint("estabelecimento_id", "mes_referencia", "versao", name="uq_folha_proc_estab_mes_versao"),
+        )
+        op.create_index("ix_folha_processamentos_estabelecimento_id", "folha_processamentos", ["estabelecimento_id"])
+
+    if "folha_processamento_itens" not in tabelas:
+        op.create_table(
+            "folha_processamento_itens",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+            sa.Column("processamento_id", sa.Integer(), nullable=False),
+            sa.Column("funcionario_id", sa.Integer(), nullable=False),
+            sa.Column("assinatura", sa.String(length=64), nullable=False),
+            sa.Column("recalculado", sa.Boolean(), nullable=False, server_default=sa.true()),
+            sa.Column("liquido", sa.Numeric(19, 4), nullable=True),
+            sa.Column("custo_real", sa.Numeric(19, 4), nullable=True),
+            sa.Column("holerite_json", sa.JSON(), nullable=False),
+            sa.Column("provisoes_json", sa.JSON(), nullable=False),
+            sa.Column("retrospectiva_json", sa.JSON(), nullable=False),
+            sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_folha_processamento_itens_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+            sa.ForeignKeyConstraint(["processamento_id"], ["folha_processamentos.id"], name=op.f("fk_folha_processamento_itens_processamento_id_folha_processamentos"), ondelete="CASCADE"),
+            sa.ForeignKeyConstraint(["funcionario_id"], ["funcionarios.id"], name=op.f("fk_folha_processamento_itens_funcionario_id_funcionarios"), ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id", name=op.f("pk_folha_processamento_itens")),
+            sa.UniqueConstraint("processamento_id", "funcionario_id", name="uq_folha_item_proc_func"),
+        )
+        op.create_index("ix_folha_processamento_itens_estabelecimento_id", "folha_processamento_itens", ["estabelecimento_id"])
+        op.create_index("ix_folha_processamento_itens_processamento_id", "folha_processamento_itens", ["processamento_id"])
+        op.create_index("ix_folha_item_funcionario", "folha_processamento_itens", ["funcionario_id"])
+
+
+def downgrade():
+    op.drop_index("ix_folha_item_funcionario", table_name="folha_processamento_itens")
+    op.drop_index("ix_folha_processamento_itens_processamento_id", table_name="folha_processamento_itens")
+    op.drop_index("ix_folha_processamento_itens_estabelecimento_id", table_name="folha_processamento_itens")
+    op.drop_table("folha_processamento_itens")
+    op.drop_index("ix_folha_processamentos_estabelecimento_id", table_name="folha_processamentos")
+    op.drop_table("folha_processamentos")
@@ -0,0 +1,47 @@
+"""fila de e-mails de saída (envio em background com retry e dead-letter)
+
+Revision ID: a8c0e2b4d6f7
+Revises: f7c9e1a3b5d6
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "a8c0e2b4d6f7"
+down_revision = "f7c9e1a3b5d6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if "emails_fila" not in inspector.get_table_names():
+        op.create_table(
+            "emails_fila",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("estabelecimento_id", sa.Integer(), nullable=True),
+            sa.Column("tipo", sa.String(length=30), nullable=False),
+            sa.Column("destinatario", sa.String(length=200), nullable=False),
+            sa.Column("assunto", sa.String(length=300), nullable=False),
+            sa.Column("corpo_texto", sa.Text(), nullable=True),
+            sa.Column("corpo_html", sa.Text(), nullable=True),
+            sa.Column("com_logo", sa.Boolean(), nullable=False, server_default=sa.false()),
+            sa.Column("status", sa.String(length=20), nullable=False),
+            sa.Column("tentativas", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("proxima_tentativa_em", sa.DateTime(), nullable=True),
+            sa.Column("ultimo_erro", sa.Text(), nullable=True),
+            sa.Column("criado_em", sa.DateTime(), nullable=False),
+            sa.Column("enviado_em", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_emails_fila_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id", name=op.f("pk_emails_fila")),
+        )
+        op.create_index("ix_emails_fila_estabelecimento_id", "emails_fila", ["estabelecimento_id"])
+        op.create_index("ix_emails_fila_pendentes", "emails_fila", ["status", "proxima_tentativa_em"])
+
+
+def downgrade():
+    op.drop_index("ix_emails_fila_pendentes", table_name="emails_fila")
+    op.drop_index("ix_emails_fila_estabelecimento_id", table_name="emails_fila")
+    op.drop_table("emails_fila")
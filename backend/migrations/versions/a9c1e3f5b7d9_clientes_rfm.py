@@ -0,0 +1,51 @@
+"""clientes_rfm: scores RFM persistidos por cliente
+
+Revision ID: a9c1e3f5b7d9
+Revises: f3b5a7c9d1e2
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "a9c1e3f5b7d9"
+down_revision = "f3b5a7c9d1e2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "clientes_rfm" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "clientes_rfm",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+        sa.Column("cliente_id", sa.Integer(), nullable=False),
+        sa.Column("janela_dias", sa.Integer(), nullable=False),
+        sa.Column("ultima_compra", sa.DateTime(), nullable=True),
+        sa.Column("recency_days", sa.Integer(), nullable=True),
+        sa.Column("frequency", sa.Integer(), nullable=True),
+        sa.Column("monetary", sa.Numeric(19, 4), nullable=True),
+        sa.Column("ticket_medio", sa.Numeric(19, 4), nullable=True),
+        sa.Column("vendas_fds", sa.Integer(), nullable=True),
+        sa.Column("vendas_promo", sa.Integer(), nullable=True),
+        sa.Column("recency_score", sa.SmallInteger(), nullable=True),
+        sa.Column("frequency_score", sa.SmallInteger(), nullable=True),
+        sa.Column("monetary_score", sa.SmallInteger(), nullable=True),
+        sa.Column("segmento", sa.String(length=20), nullable=False),
+        sa.Column("perfil", sa.String(length=30), nullable=False),
+        sa.Column("calculado_em", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_clientes_rfm_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["cliente_id"], ["clientes.id"], name=op.f("fk_clientes_rfm_cliente_id_clientes"), ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_clientes_rfm")),
+        sa.UniqueConstraint("cliente_id", name="uq_cliente_rfm_cliente"),
+    )
+    op.create_index("ix_clientes_rfm_estabelecimento_id", "clientes_rfm", ["estabelecimento_id"])
+    op.create_index("ix_cliente_rfm_estab_segmento", "clientes_rfm", ["estabelecimento_id", "segmento"])
+
+
+def downgrade():
+    op.drop_index("ix_cliente_rfm_estab_segmento", table_name="clientes_rfm")
+    op.drop_index("ix_clientes_rfm_estabelecimento_id", table_name="clientes_rfm")
+    op.drop_table("clientes_rfm")
@@ -0,0 +1,52 @@
+"""alertas_estoque: estado persistido dos alertas de estoque/validade
+
+Revision ID: b2d4f6a8c0e1
+Revises: a9c1e3f5b7d9
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "b2d4f6a8c0e1"
+down_revision = "a9c1e3f5b7d9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "alertas_estoque" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "alertas_estoque",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+        sa.Column("chave", sa.String(length=80), nullable=False),
+        sa.Column("tipo", sa.String(length=30), nullable=False),
+        sa.Column("nivel", sa.String(length=10), nullable=False),
+        sa.Column("estado", sa.String(length=10), nullable=False),
+        sa.Column("produto_id", sa.Integer(), nullable=False),
+        sa.Column("lote_id", sa.Integer(), nullable=True),
+        sa.Column("dados", sa.JSON(), nullable=True),
+        sa.Column("detectado_em", sa.DateTime(), nullable=False),
+        sa.Column("atualizado_em", sa.DateTime(), nullable=False),
+        sa.Column("resolvido_em", sa.DateTime(), nullable=True),
+        sa.Column("notificado_em", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_alertas_estoque_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["produto_id"], ["produtos.id"], name=op.f("fk_alertas_estoque_produto_id_produtos"), ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["lote_id"], ["produto_lotes.id"], name=op.f("fk_alertas_estoque_lote_id_produto_lotes"), ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_alertas_estoque")),
+        sa.UniqueConstraint("estabelecimento_id", "chave", name="uq_alerta_estoque_estab_chave"),
+    )
+    op.create_index("ix_alertas_estoque_estabelecimento_id", "alertas_estoque", ["estabelecimento_id"])
+    op.create_index("ix_alertas_estoque_produto_id", "alertas_estoque", ["produto_id"])
+    op.create_index("ix_alertas_estoque_lote_id", "alertas_estoque", ["lote_id"])
+    op.create_index("ix_alerta_estoque_estab_estado", "alertas_estoque", ["estabelecimento_id", "estado"])
+
+
+def downgrade():
+    op.drop_index("ix_alerta_estoque_estab_estado", table_name="alertas_estoque")
+    op.drop_index("ix_alertas_estoque_lote_id", table_name="alertas_estoque")
+    op.drop_index("ix_alertas_estoque_produto_id", table_name="alertas_estoque")
+    op.drop_index("ix_alertas_estoque_estabelecimento_id", table_name="alertas_estoque")
+    op.drop_table("alertas_estoque")
@@ -0,0 +1,53 @@
+"""banco_horas_lancamentos: razão só de inserção do banco de horas
+
+Revision ID: b6d8f0a2c4e5
+Revises: a5c7e9f1b3d4
+Create Date: 2026-10-19
+
+O histórico é lançado depois do upgrade com
+``flask verificar-banco-horas --corrigir`` (refaz cada dia das batidas e
+grava lançamentos de reconciliação); a partir daí cada batida lança o seu dia.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "b6d8f0a2c4e5"
+down_revision = "a5c7e9f1b3d4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "banco_horas_lancamentos" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "banco_horas_lancamentos",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+        sa.Column("funcionario_id", sa.Integer(), nullable=False),
+        sa.Column("sequencia", sa.Integer(), nullable=False),
+        sa.Column("data", sa.Date(), nullable=False),
+        sa.Column("origem", sa.String(length=20), nullable=False),
+        sa.Column("referencia_id", sa.Integer(), nullable=True),
+        sa.Column("minutos_trabalhados", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("minutos_esperados", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("valor_dia", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("delta_minutos", sa.Integer(), nullable=False),
+        sa.Column("saldo_minutos", sa.Integer(), nullable=False),
+        sa.Column("criado_em", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_banco_horas_lancamentos_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["funcionario_id"], ["funcionarios.id"], name=op.f("fk_banco_horas_lancamentos_funcionario_id_funcionarios"), ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_banco_horas_lancamentos")),
+        sa.UniqueConstraint("funcionario_id", "sequencia", name="uq_banco_lanc_func_seq"),
+    )
+    op.create_index("ix_banco_horas_lancamentos_estabelecimento_id", "banco_horas_lancamentos", ["estabelecimento_id"])
+    op.create_index("ix_banco_lanc_func_data", "banco_horas_lancamentos", ["funcionario_id", "data", "sequencia"])
+    op.create_index("ix_banco_lanc_func_criado", "banco_horas_lancamentos", ["funcionario_id", "criado_em"])
+
+
+def downgrade():
+    op.drop_index("ix_banco_lanc_func_criado", table_name="banco_horas_lancamentos")
+    op.drop_index("ix_banco_lanc_func_data", table_name="banco_horas_lancamentos")
+    op.drop_index("ix_banco_horas_lancamentos_estabelecimento_id", table_name="banco_horas_lancamentos")
+    op.drop_table("banco_horas_lancamentos")
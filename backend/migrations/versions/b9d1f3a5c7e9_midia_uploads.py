@@ -0,0 +1,54 @@
+"""pipeline de mídia: uploads no spool aguardando otimização/publicação
+
+Revision ID: b9d1f3a5c7e9
+Revises: a8c0e2b4d6f7
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "b9d1f3a5c7e9"
+down_revision = "a8c0e2b4d6f7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if "midia_uploads" not in inspector.get_table_names():
+        op.create_table(
+            "midia_uploads",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("handle", sa.String(length=32), nullable=False),
+            sa.Column("estabelecimento_id", sa.Integer(), nullable=True),
+            sa.Column("categoria", sa.String(length=40), nullable=False),
+            sa.Column("nome", sa.String(length=200), nullable=False),
+            sa.Column("content_type", sa.String(length=100), nullable=True),
+            sa.Column("tamanho", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("caminho_spool", sa.String(length=500), nullable=True),
+            sa.Column("host", sa.String(length=100), nullable=True),
+            sa.Column("status", sa.String(length=20), nullable=False),
+            sa.Column("tentativas", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("proxima_tentativa_em", sa.DateTime(), nullable=True),
+            sa.Column("ultimo_erro", sa.Text(), nullable=True),
+            sa.Column("url", sa.String(length=500), nullable=True),
+            sa.Column("url_miniatura", sa.String(length=500), nullable=True),
+            sa.Column("destino_tabela", sa.String(length=60), nullable=True),
+            sa.Column("destino_id", sa.Integer(), nullable=True),
+            sa.Column("destino_coluna", sa.String(length=60), nullable=True),
+            sa.Column("criado_em", sa.DateTime(), nullable=False),
+            sa.Column("concluido_em", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_midia_uploads_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id", name=op.f("pk_midia_uploads")),
+            sa.UniqueConstraint("handle", name=op.f("uq_midia_uploads_handle")),
+        )
+        op.create_index("ix_midia_uploads_estabelecimento_id", "midia_uploads", ["estabelecimento_id"])
+        op.create_index("ix_midia_uploads_pendentes", "midia_uploads", ["status", "proxima_tentativa_em"])
+
+
+def downgrade():
+    op.drop_index("ix_midia_uploads_pendentes", table_name="midia_uploads")
+    op.drop_index("ix_midia_uploads_estabelecimento_id", table_name="midia_uploads")
+    op.drop_table("midia_uploads")
@@ -0,0 +1,52 @@
+"""exportações em background: jobs e arquivos gerados para download
+
+Revision ID: c1e3a5b7d9f0
+Revises: b9d1f3a5c7e9
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "c1e3a5b7d9f0"
+down_revision = "b9d1f3a5c7e9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if "exportacoes_arquivos" not in inspector.get_table_names():
+        op.create_table(
+            "exportacoes_arquivos",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("handle", sa.String(length=32), nullable=False),
+            sa.Column("estabelecimento_id", sa.Integer(), nullable=True),
+            sa.Column("funcionario_id", sa.Integer(), nullable=True),
+            sa.Column("tipo", sa.String(length=40), nullable=False),
+            sa.Column("formato", sa.String(length=10), nullable=False),
+            sa.Column("filtros_json", sa.Text(), nullable=True),
+            sa.Column("nome_arquivo", sa.String(length=200), nullable=False),
+            sa.Column("status", sa.String(length=20), nullable=False),
+            sa.Column("tentativas", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("proxima_tentativa_em", sa.DateTime(), nullable=True),
+            sa.Column("ultimo_erro", sa.Text(), nullable=True),
+            sa.Column("caminho", sa.String(length=500), nullable=True),
+            sa.Column("linhas", sa.Integer(), nullable=True),
+            sa.Column("tamanho", sa.BigInteger(), nullable=True),
+            sa.Column("criado_em", sa.DateTime(), nullable=False),
+            sa.Column("concluido_em", sa.DateTime(), nullable=True),
+            sa.Column("expira_em", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_exportacoes_arquivos_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id", name=op.f("pk_exportacoes_arquivos")),
+            sa.UniqueConstraint("handle", name=op.f("uq_exportacoes_arquivos_handle")),
+        )
+        op.create_index("ix_exportacoes_arquivos_estabelecimento_id", "exportacoes_arquivos", ["estabelecimento_id"])
+        op.create_index("ix_exportacoes_arquivos_pendentes", "exportacoes_arquivos", ["status", "proxima_tentativa_em"])
+
+
+def downgrade():
+    op.drop_index("ix_exportacoes_arquivos_pendentes", table_name="exportacoes_arquivos")
+    op.drop_index("ix_exportacoes_arquivos_estabelecimento_id", table_name="exportacoes_arquivos")
+    op.drop_table("exportacoes_arquivos")
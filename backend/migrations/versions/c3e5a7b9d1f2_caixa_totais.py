@@ -0,0 +1,60 @@
+"""caixa_totais: totais correntes do caixa por tipo e forma de pagamento
+
+Revision ID: c3e5a7b9d1f2
+Revises: b2d4f6a8c0e1
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "c3e5a7b9d1f2"
+down_revision = "b2d4f6a8c0e1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "caixa_totais" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "caixa_totais",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+        sa.Column("caixa_id", sa.Integer(), nullable=False),
+        sa.Column("tipo", sa.String(length=20), nullable=False),
+        sa.Column("forma_pagamento", sa.String(length=20), nullable=False),
+        sa.Column("quantidade", sa.Integer(), nullable=False),
+        sa.Column("total", sa.Numeric(19, 4), nullable=False),
+        sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_caixa_totais_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["caixa_id"], ["caixas.id"], name=op.f("fk_caixa_totais_caixa_id_caixas"), ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_caixa_totais")),
+        sa.UniqueConstraint("caixa_id", "tipo", "forma_pagamento", name="uq_caixa_total_chave"),
+    )
+    op.create_index("ix_caixa_totais_estabelecimento_id", "caixa_totais", ["estabelecimento_id"])
+
+    # Backfill a partir do livro (mesma normalização de app.models.normalizar_forma_caixa)
+    op.execute(
+        """
+        INSERT INTO caixa_totais (estabelecimento_id, caixa_id, tipo, forma_pagamento, quantidade, total)
+        SELECT estabelecimento_id, caixa_id, tipo, forma, COUNT(*), SUM(valor)
+        FROM (
+            SELECT estabelecimento_id, caixa_id, LOWER(tipo) AS tipo, valor,
+                   CASE
+                       WHEN LOWER(forma_pagamento) LIKE '%cr_dito%' THEN 'cartao_credito'
+                       WHEN LOWER(forma_pagamento) LIKE '%d_bito%' THEN 'cartao_debito'
+                       WHEN LOWER(forma_pagamento) LIKE '%pix%' THEN 'pix'
+                       WHEN LOWER(forma_pagamento) LIKE '%dinheiro%' THEN 'dinheiro'
+                       WHEN LOWER(forma_pagamento) LIKE '%fiado%' THEN 'fiado'
+                       ELSE 'outros'
+                   END AS forma
+            FROM movimentacoes_caixa
+        ) m
+        GROUP BY estabelecimento_id, caixa_id, tipo, forma
+        """
+    )
+
+
+def downgrade():
+    op.drop_index("ix_caixa_totais_estabelecimento_id", table_name="caixa_totais")
+    op.drop_table("caixa_totais")
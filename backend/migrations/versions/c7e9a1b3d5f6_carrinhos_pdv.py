@@ -0,0 +1,57 @@
+"""carrinhos_pdv: estado quente do carrinho do PDV com versão otimista
+
+Revision ID: c7e9a1b3d5f6
+Revises: b6d8f0a2c4e5
+Create Date: 2026-10-19
+
+Vendas em andamento abertas antes do upgrade não têm linha aqui: o
+carrinho_service a recria do checkpoint (VendaItem) no primeiro acesso.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "c7e9a1b3d5f6"
+down_revision = "b6d8f0a2c4e5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "carrinhos_pdv" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "carrinhos_pdv",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+        sa.Column("venda_id", sa.Integer(), nullable=True),
+        sa.Column("funcionario_id", sa.Integer(), nullable=False),
+        sa.Column("cliente_id", sa.Integer(), nullable=True),
+        sa.Column("codigo_temp", sa.String(length=50), nullable=True),
+        sa.Column("status", sa.String(length=20), nullable=False, server_default="aberto"),
+        sa.Column("versao", sa.Integer(), nullable=False, server_default="1"),
+        sa.Column("itens_json", sa.JSON(), nullable=False),
+        sa.Column("subtotal", sa.Numeric(19, 4), nullable=False, server_default="0"),
+        sa.Column("desconto", sa.Numeric(19, 4), nullable=False, server_default="0"),
+        sa.Column("total", sa.Numeric(19, 4), nullable=False, server_default="0"),
+        sa.Column("quantidade_itens", sa.Numeric(10, 3), nullable=False, server_default="0"),
+        sa.Column("checkpoint_versao", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("checkpoint_em", sa.DateTime(), nullable=True),
+        sa.Column("venda_final_id", sa.Integer(), nullable=True),
+        sa.Column("criado_em", sa.DateTime(), nullable=False),
+        sa.Column("atualizado_em", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_carrinhos_pdv_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["venda_id"], ["vendas.id"], name=op.f("fk_carrinhos_pdv_venda_id_vendas"), ondelete="SET NULL"),
+        sa.ForeignKeyConstraint(["funcionario_id"], ["funcionarios.id"], name=op.f("fk_carrinhos_pdv_funcionario_id_funcionarios")),
+        sa.ForeignKeyConstraint(["cliente_id"], ["clientes.id"], name=op.f("fk_carrinhos_pdv_cliente_id_clientes")),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_carrinhos_pdv")),
+        sa.UniqueConstraint("venda_id", name=op.f("uq_carrinhos_pdv_venda_id")),
+    )
+    op.create_index("ix_carrinhos_pdv_estabelecimento_id", "carrinhos_pdv", ["estabelecimento_id"])
+    op.create_index("ix_carrinho_pdv_estab_status", "carrinhos_pdv", ["estabelecimento_id", "status"])
+
+
+def downgrade():
+    op.drop_index("ix_carrinho_pdv_estab_status", table_name="carrinhos_pdv")
+    op.drop_index("ix_carrinhos_pdv_estabelecimento_id", table_name="carrinhos_pdv")
+    op.drop_table("carrinhos_pdv")
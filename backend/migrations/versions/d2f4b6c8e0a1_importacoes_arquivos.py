@@ -0,0 +1,56 @@
+"""importações em massa de CSV: jobs com progresso, simulação e erros por linha
+
+Revision ID: d2f4b6c8e0a1
+Revises: c1e3a5b7d9f0
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "d2f4b6c8e0a1"
+down_revision = "c1e3a5b7d9f0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if "importacoes_arquivos" not in inspector.get_table_names():
+        op.create_table(
+            "importacoes_arquivos",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("handle", sa.String(length=32), nullable=False),
+            sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+            sa.Column("funcionario_id", sa.Integer(), nullable=True),
+            sa.Column("tipo", sa.String(length=40), nullable=False),
+            sa.Column("nome_arquivo", sa.String(length=200), nullable=False),
+            sa.Column("caminho", sa.String(length=500), nullable=True),
+            sa.Column("simulacao", sa.Boolean(), nullable=False, server_default=sa.false()),
+            sa.Column("atualizar_existentes", sa.Boolean(), nullable=False, server_default=sa.false()),
+            sa.Column("status", sa.String(length=20), nullable=False),
+            sa.Column("tentativas", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("proxima_tentativa_em", sa.DateTime(), nullable=True),
+            sa.Column("ultimo_erro", sa.Text(), nullable=True),
+            sa.Column("total_linhas", sa.Integer(), nullable=True),
+            sa.Column("linhas_processadas", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("inseridos", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("atualizados", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("rejeitados", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("erros_json", sa.Text(), nullable=True),
+            sa.Column("criado_em", sa.DateTime(), nullable=False),
+            sa.Column("iniciado_em", sa.DateTime(), nullable=True),
+            sa.Column("concluido_em", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_importacoes_arquivos_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id", name=op.f("pk_importacoes_arquivos")),
+            sa.UniqueConstraint("handle", name=op.f("uq_importacoes_arquivos_handle")),
+        )
+        op.create_index("ix_importacoes_arquivos_estabelecimento_id", "importacoes_arquivos", ["estabelecimento_id"])
+        op.create_index("ix_importacoes_arquivos_pendentes", "importacoes_arquivos", ["status", "proxima_tentativa_em"])
+
+
+def downgrade():
+    op.drop_index("ix_importacoes_arquivos_pendentes", table_name="importacoes_arquivos")
+    op.drop_index("ix_importacoes_arquivos_estabelecimento_id", table_name="importacoes_arquivos")
+    op.drop_table("importacoes_arquivos")
@@ -0,0 +1,71 @@
+"""fornecedores_metricas: snapshot analítico e de busca por fornecedor
+
+Revision ID: d4f6a8c0e2b3
+Revises: c3e5a7b9d1f2
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "d4f6a8c0e2b3"
+down_revision = "c3e5a7b9d1f2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "fornecedores_metricas" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "fornecedores_metricas",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+        sa.Column("fornecedor_id", sa.Integer(), nullable=False),
+        sa.Column("nome_fantasia", sa.String(length=150), nullable=False),
+        sa.Column("nome_busca", sa.String(length=500), nullable=False),
+        sa.Column("cnpj_digitos", sa.String(length=14), nullable=False),
+        sa.Column("estado", sa.String(length=2), nullable=True),
+        sa.Column("ativo", sa.Boolean(), nullable=False),
+        sa.Column("data_cadastro", sa.DateTime(), nullable=True),
+        sa.Column("total_pedidos", sa.Integer(), nullable=False),
+        sa.Column("pedidos_recebidos", sa.Integer(), nullable=False),
+        sa.Column("valor_comprado", sa.Numeric(19, 4), nullable=False),
+        sa.Column("ultima_compra", sa.DateTime(), nullable=True),
+        sa.Column("contas_abertas", sa.Integer(), nullable=False),
+        sa.Column("valor_em_aberto", sa.Numeric(19, 4), nullable=False),
+        sa.Column("classificacao", sa.String(length=20), nullable=False),
+        sa.Column("atualizado_em", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_fornecedores_metricas_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["fornecedor_id"], ["fornecedores.id"], name=op.f("fk_fornecedores_metricas_fornecedor_id_fornecedores"), ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_fornecedores_metricas")),
+        sa.UniqueConstraint("fornecedor_id", name="uq_fornecedor_metrica_fornecedor"),
+    )
+    op.create_index("ix_fornecedores_metricas_estabelecimento_id", "fornecedores_metricas", ["estabelecimento_id"])
+    op.create_index("ix_fornecedor_metrica_estab_nome", "fornecedores_metricas", ["estabelecimento_id", "nome_busca"])
+    op.create_index("ix_fornecedor_metrica_estab_cnpj", "fornecedores_metricas", ["estabelecimento_id", "cnpj_digitos"])
+
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        # LIKE '%termo%' usa índice trigram quando a extensão está disponível; sem
+        # ela a busca continua correta (varredura de uma tabela estreita).
+        try:
+            with bind.begin_nested():
+                op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                op.execute(
+                    "CREATE INDEX ix_fornecedor_metrica_nome_trgm ON fornecedores_metricas "
+                    "USING gin (nome_busca gin_trgm_ops)"
+                )
+        except Exception:
+            pass
+    # O preenchimento (normalização de acentos em Python) fica a cargo de
+    # `flask recalcular-metricas-fornecedores` ou da conferência preguiçosa na
+    # primeira leitura de cada estabelecimento.
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_fornecedor_metrica_nome_trgm")
+    op.drop_index("ix_fornecedor_metrica_estab_cnpj", table_name="fornecedores_metricas")
+    op.drop_index("ix_fornecedor_metrica_estab_nome", table_name="fornecedores_metricas")
+    op.drop_index("ix_fornecedores_metricas_estabelecimento_id", table_name="fornecedores_metricas")
+    op.drop_table("fornecedores_metricas")
@@ -0,0 +1,33 @@
+"""vendas.data_venda normalizada (NOT NULL) + índice (estabelecimento, data, status)
+
+Revision ID: d8f0b2c4e6a7
+Revises: c7e9a1b3d5f6
+Create Date: 2026-10-19
+
+Vendas antigas sem data_venda recebem created_at. Com a coluna sempre
+preenchida, os filtros de período deixam de usar COALESCE(data_venda,
+created_at) e passam a usar o índice composto.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "d8f0b2c4e6a7"
+down_revision = "c7e9a1b3d5f6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE vendas SET data_venda = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE data_venda IS NULL")
+    with op.batch_alter_table("vendas", schema=None) as batch_op:
+        batch_op.alter_column("data_venda", existing_type=sa.DateTime(), nullable=False)
+    indices = {i["name"] for i in sa.inspect(op.get_bind()).get_indexes("vendas")}
+    if "ix_venda_estab_data_status" not in indices:
+        op.create_index("ix_venda_estab_data_status", "vendas", ["estabelecimento_id", "data_venda", "status"])
+
+
+def downgrade():
+    op.drop_index("ix_venda_estab_data_status", table_name="vendas")
+    with op.batch_alter_table("vendas", schema=None) as batch_op:
+        batch_op.alter_column("data_venda", existing_type=sa.DateTime(), nullable=True)
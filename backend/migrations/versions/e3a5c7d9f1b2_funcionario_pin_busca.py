@@ -0,0 +1,33 @@
+"""PIN de segurança: chave de busca HMAC (pepper) indexada por estabelecimento
+
+Revision ID: e3a5c7d9f1b2
+Revises: d2f4b6c8e0a1
+Create Date: 2026-10-19
+
+Sem backfill: a chave depende do PIN em claro, que o banco não tem. PINs já
+cadastrados seguem válidos e recebem a chave no primeiro uso (pin_service).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "e3a5c7d9f1b2"
+down_revision = "d2f4b6c8e0a1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    colunas = {c["name"] for c in inspector.get_columns("funcionarios")}
+    if "pin_busca" not in colunas:
+        op.add_column("funcionarios", sa.Column("pin_busca", sa.String(length=80), nullable=True))
+    indices = {i["name"] for i in inspector.get_indexes("funcionarios")}
+    if "ix_funcionario_pin_busca" not in indices:
+        op.create_index("ix_funcionario_pin_busca", "funcionarios", ["estabelecimento_id", "pin_busca"])
+
+
+def downgrade():
+    op.drop_index("ix_funcionario_pin_busca", table_name="funcionarios")
+    op.drop_column("funcionarios", "pin_busca")
@@ -0,0 +1,73 @@
+"""fila de emissão NFC-e: numeração atômica por série, lacunas e colunas de fila
+
+Revision ID: e5a7c9e1f3b4
+Revises: d4f6a8c0e2b3
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "e5a7c9e1f3b4"
+down_revision = "d4f6a8c0e2b3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    tabelas = inspector.get_table_names()
+
+    columns = [c["name"] for c in inspector.get_columns("documentos_fiscais")]
+    with op.batch_alter_table("documentos_fiscais", schema=None) as batch_op:
+        if "tentativas" not in columns:
+            batch_op.add_column(sa.Column("tentativas", sa.Integer(), nullable=False, server_default="0"))
+        if "proxima_tentativa_em" not in columns:
+            batch_op.add_column(sa.Column("proxima_tentativa_em", sa.DateTime(), nullable=True))
+            batch_op.create_index("ix_docfiscal_fila", ["status", "proxima_tentativa_em"])
+
+    if "numeracao_fiscal" not in tabelas:
+        op.create_table(
+            "numeracao_fiscal",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+            sa.Column("modelo", sa.String(length=2), nullable=False),
+            sa.Column("serie", sa.Integer(), nullable=False),
+            sa.Column("proximo_numero", sa.Integer(), nullable=False),
+            sa.Column("atualizado_em", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_numeracao_fiscal_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id", name=op.f("pk_numeracao_fiscal")),
+            sa.UniqueConstraint("estabelecimento_id", "modelo", "serie", name="uq_numeracao_fiscal_serie"),
+        )
+        op.create_index("ix_numeracao_fiscal_estabelecimento_id", "numeracao_fiscal", ["estabelecimento_id"])
+
+    if "numeracao_fiscal_lacunas" not in tabelas:
+        op.create_table(
+            "numeracao_fiscal_lacunas",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+            sa.Column("modelo", sa.String(length=2), nullable=False),
+            sa.Column("serie", sa.Integer(), nullable=False),
+            sa.Column("numero", sa.Integer(), nullable=False),
+            sa.Column("documento_id", sa.Integer(), nullable=True),
+            sa.Column("motivo", sa.Text(), nullable=True),
+            sa.Column("criado_em", sa.DateTime(), nullable=False),
+            sa.Column("inutilizada_em", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_numeracao_fiscal_lacunas_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+            sa.ForeignKeyConstraint(["documento_id"], ["documentos_fiscais.id"], name=op.f("fk_numeracao_fiscal_lacunas_documento_id_documentos_fiscais"), ondelete="SET NULL"),
+            sa.PrimaryKeyConstraint("id", name=op.f("pk_numeracao_fiscal_lacunas")),
+            sa.UniqueConstraint("estabelecimento_id", "modelo", "serie", "numero", name="uq_numeracao_lacuna_numero"),
+        )
+        op.create_index("ix_numeracao_fiscal_lacunas_estabelecimento_id", "numeracao_fiscal_lacunas", ["estabelecimento_id"])
+
+
+def downgrade():
+    op.drop_index("ix_numeracao_fiscal_lacunas_estabelecimento_id", table_name="numeracao_fiscal_lacunas")
+    op.drop_table("numeracao_fiscal_lacunas")
+    op.drop_index("ix_numeracao_fiscal_estabelecimento_id", table_name="numeracao_fiscal")
+    op.drop_table("numeracao_fiscal")
+    with op.batch_alter_table("documentos_fiscais", schema=None) as batch_op:
+        batch_op.drop_index("ix_docfiscal_fila")
+        batch_op.drop_column("proxima_tentativa_em")
+        batch_op.drop_column("tentativas")
@@ -0,0 +1,39 @@
+"""created_at preenchido + indexado em venda_itens e pagamentos (chave de partição)
+
+Revision ID: e9a1c3d5f7b8
+Revises: d8f0b2c4e6a7
+Create Date: 2026-10-19
+
+venda_itens e pagamentos são particionados por mês em created_at no Postgres
+(ParticionamentoService / flask particionar-tabelas). Linhas antigas sem
+created_at herdam a data da venda, e o índice em created_at atende o filtro
+de janela (janela_particionada) nos bancos sem particionamento nativo.
+A conversão das tabelas em si não roda aqui: é opcional e explícita.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "e9a1c3d5f7b8"
+down_revision = "d8f0b2c4e6a7"
+branch_labels = None
+depends_on = None
+
+_INDICES = (("venda_itens", "ix_venda_item_created"), ("pagamentos", "ix_pagamento_created"))
+
+
+def upgrade():
+    for tabela, _ in _INDICES:
+        op.execute(
+            f"UPDATE {tabela} SET created_at = (SELECT v.data_venda FROM vendas v WHERE v.id = {tabela}.venda_id) "
+            f"WHERE created_at IS NULL"
+        )
+    inspector = sa.inspect(op.get_bind())
+    for tabela, indice in _INDICES:
+        if indice not in {i["name"] for i in inspector.get_indexes(tabela)}:
+            op.create_index(indice, tabela, ["created_at"])
+
+
+def downgrade():
+    for tabela, indice in _INDICES:
+        op.drop_index(indice, table_name=tabela)
@@ -0,0 +1,47 @@
+"""índices compostos (estabelecimento_id, data, status) das tabelas de período
+
+Revision ID: f1b3d5e7a9c2
+Revises: e9a1c3d5f7b8
+Create Date: 2026-10-19
+
+Os filtros de período passam a comparar a coluna nua numa faixa semiaberto
+(query_helpers.filtro_periodo) em vez de func.date()/EXTRACT; com o tenant na
+frente, o mesmo índice atende o filtro de loja + período + status.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "f1b3d5e7a9c2"
+down_revision = "e9a1c3d5f7b8"
+branch_labels = None
+depends_on = None
+
+_INDICES = (
+    ("movimentacoes_estoque", "ix_mov_estoque_estab_data_tipo", ["estabelecimento_id", "created_at", "tipo"]),
+    ("contas_pagar", "ix_conta_pagar_estab_venc_status", ["estabelecimento_id", "data_vencimento", "status"]),
+    ("contas_receber", "ix_conta_receber_estab_venc_status", ["estabelecimento_id", "data_vencimento", "status"]),
+    ("despesas", "ix_despesa_estab_data", ["estabelecimento_id", "data_despesa"]),
+    ("registros_ponto", "ix_ponto_estab_data_status", ["estabelecimento_id", "data", "status"]),
+    ("auditoria", "ix_auditoria_estab_data_tipo", ["estabelecimento_id", "data_evento", "tipo_evento"]),
+    ("pedidos_venda", "ix_pedido_venda_estab_data_status", ["estabelecimento_id", "data_emissao", "status"]),
+    ("entregas", "ix_entrega_estab_created_status", ["estabelecimento_id", "created_at", "status"]),
+    # Entrega.data_referencia: índice de expressão sobre o mesmo COALESCE do filtro
+    ("entregas", "ix_entrega_estab_data_ref",
+     ["estabelecimento_id", sa.text("coalesce(data_entrega, data_saida, created_at)")]),
+)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tabelas = set(inspector.get_table_names())
+    for tabela, indice, colunas in _INDICES:
+        if tabela in tabelas and indice not in {i["name"] for i in inspector.get_indexes(tabela)}:
+            op.create_index(indice, tabela, colunas)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    for tabela, indice, _ in _INDICES:
+        if indice in {i["name"] for i in inspector.get_indexes(tabela)}:
+            op.drop_index(indice, table_name=tabela)
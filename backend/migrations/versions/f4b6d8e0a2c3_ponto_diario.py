@@ -0,0 +1,157 @@
+"""ponto_diario: consolidado diário do ponto por funcionário
+
+Revision ID: f4b6d8e0a2c3
+Revises: e3a5c7d9f1b2
+Create Date: 2026-10-19
+
+O histórico de registros_ponto é consolidado no próprio upgrade (mesma regra
+de app.services.ponto_diario_service.consolidar, congelada aqui para não
+depender dos modelos), em streaming e gravado em lotes; a partir daí cada
+batida mantém a sua linha. ``flask reconstruir-ponto-diario`` refaz o mesmo
+consolidado sob demanda.
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "f4b6d8e0a2c3"
+down_revision = "e3a5c7d9f1b2"
+branch_labels = None
+depends_on = None
+
+
+_JORNADA_PADRAO_MIN = 480
+_LOTE = 5000
+
+
+def upgrade():
+    if "ponto_diario" not in sa.inspect(op.get_bind()).get_table_names():
+        _criar_tabela()
+    _consolidar_historico(op.get_bind())
+
+
+def _criar_tabela():
+    op.create_table(
+        "ponto_diario",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("estabelecimento_id", sa.Integer(), nullable=False),
+        sa.Column("funcionario_id", sa.Integer(), nullable=False),
+        sa.Column("data", sa.Date(), nullable=False),
+        sa.Column("primeira_entrada", sa.Time(), nullable=True),
+        sa.Column("inicio_intervalo", sa.Time(), nullable=True),
+        sa.Column("fim_intervalo", sa.Time(), nullable=True),
+        sa.Column("ultima_saida", sa.Time(), nullable=True),
+        sa.Column("presente", sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column("batidas", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("batidas_atrasadas", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("minutos_trabalhados", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("minutos_atraso", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("minutos_atraso_entrada", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("entrada_atrasada", sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column("minutos_extras", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("observacao", sa.Text(), nullable=True),
+        sa.Column("atualizado_em", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["estabelecimento_id"], ["estabelecimentos.id"], name=op.f("fk_ponto_diario_estabelecimento_id_estabelecimentos"), ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["funcionario_id"], ["funcionarios.id"], name=op.f("fk_ponto_diario_funcionario_id_funcionarios"), ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_ponto_diario")),
+        sa.UniqueConstraint("funcionario_id", "data", name="uq_ponto_diario_func_data"),
+    )
+    op.create_index("ix_ponto_diario_estabelecimento_id", "ponto_diario", ["estabelecimento_id"])
+    op.create_index("ix_ponto_diario_estab_data", "ponto_diario", ["estabelecimento_id", "data"])
+
+
+def _minutos(t):
+    return t.hour * 60 + t.minute
+
+
+def _consolidar(registros, jornada_min):
+    entrada = saida = ii = iff = None
+    atraso = atraso_entrada = batidas = atrasadas = 0
+    entrada_atrasada = False
+    observacao = None
+    for r in registros:
+        batidas += 1
+        if r.status == "atrasado":
+            atrasadas += 1
+        if r.tipo_registro in ("entrada", "saida_almoco", "retorno_almoco"):
+            atraso += r.minutos_atraso or 0
+        if r.tipo_registro == "entrada":
+            if entrada is None or r.hora < entrada:
+                entrada = r.hora
+            atraso_entrada += r.minutos_atraso or 0
+            entrada_atrasada = entrada_atrasada or r.status == "atrasado"
+        elif r.tipo_registro == "saida_almoco":
+            ii = r.hora
+        elif r.tipo_registro == "retorno_almoco":
+            iff = r.hora
+        elif r.tipo_registro == "saida":
+            if saida is None or r.hora > saida:
+                saida = r.hora
+        if r.observacao:
+            observacao = r.observacao
+
+    trabalhados = extras = 0
+    if entrada and saida:
+        trabalhados = _minutos(saida) - _minutos(entrada)
+        if ii and iff:
+            trabalhados -= _minutos(iff) - _minutos(ii)
+        trabalhados = max(0, trabalhados)
+        extras = max(0, trabalhados - jornada_min)
+    return {
+        "primeira_entrada": entrada, "inicio_intervalo": ii, "fim_intervalo": iff, "ultima_saida": saida,
+        "presente": entrada is not None, "batidas": batidas, "batidas_atrasadas": atrasadas,
+        "minutos_trabalhados": trabalhados, "minutos_atraso": atraso, "minutos_atraso_entrada": atraso_entrada,
+        "entrada_atrasada": entrada_atrasada, "minutos_extras": extras, "observacao": observacao,
+    }
+
+
+def _consolidar_historico(conn):
+    """Uma linha por (funcionário, dia) com batidas; só roda com ponto_diario vazia."""
+    if conn.execute(sa.text("SELECT 1 FROM ponto_diario LIMIT 1")).first():
+        return
+    tipos = {"data": sa.Date, "atualizado_em": sa.DateTime, "primeira_entrada": sa.Time, "inicio_intervalo": sa.Time,
+             "fim_intervalo": sa.Time, "ultima_saida": sa.Time, "presente": sa.Boolean, "entrada_atrasada": sa.Boolean}
+    destino = sa.table("ponto_diario", *(sa.column(c, tipos.get(c)) for c in (
+        "funcionario_id", "estabelecimento_id", "data", "atualizado_em", "primeira_entrada", "inicio_intervalo",
+        "fim_intervalo", "ultima_saida", "presente", "batidas", "batidas_atrasadas", "minutos_trabalhados",
+        "minutos_atraso", "minutos_atraso_entrada", "entrada_atrasada", "minutos_extras", "observacao",
+    )))
+    jornadas = {
+        estab_id: jornada for estab_id, jornada in conn.execute(sa.text(
+            "SELECT estabelecimento_id, jornada_diaria_minutos FROM configuracoes_horario"
+        )) if jornada
+    }
+    registros = conn.execution_options(stream_results=True, yield_per=_LOTE).execute(sa.text(
+        "SELECT funcionario_id, estabelecimento_id, data, hora, tipo_registro, status, minutos_atraso, observacao "
+        "FROM registros_ponto ORDER BY funcionario_id, data, hora"
+    ).columns(data=sa.Date, hora=sa.Time))
+    agora = datetime.utcnow()
+    linhas, chave_atual, dia_atual = [], None, []
+
+    def _fechar():
+        fid, estab_id, dia = chave_atual
+        linhas.append({"funcionario_id": fid, "estabelecimento_id": estab_id, "data": dia, "atualizado_em": agora,
+                       **_consolidar(dia_atual, jornadas.get(estab_id, _JORNADA_PADRAO_MIN))})
+
+    for r in registros:
+        chave = (r.funcionario_id, r.estabelecimento_id, r.data)
+        if chave != chave_atual and dia_atual:
+            _fechar()
+            dia_atual = []
+            if len(linhas) >= _LOTE:
+                conn.execute(destino.insert(), linhas)
+                linhas = []
+        chave_atual = chave
+        dia_atual.append(r)
+    if dia_atual:
+        _fechar()
+    if linhas:
+        conn.execute(destino.insert(), linhas)
+
+
+def downgrade():
+    op.drop_index("ix_ponto_diario_estab_data", table_name="ponto_diario")
+    op.drop_index("ix_ponto_diario_estabelecimento_id", table_name="ponto_diario")
+    op.drop_table("ponto_diario")
@@ -0,0 +1,32 @@
+"""contingência NFC-e: data de entrada em contingência no documento fiscal
+
+Revision ID: f7c9e1a3b5d6
+Revises: e5a7c9e1f3b4
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "f7c9e1a3b5d6"
+down_revision = "e5a7c9e1f3b4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    columns = [c["name"] for c in inspector.get_columns("documentos_fiscais")]
+    if "contingencia_em" not in columns:
+        with op.batch_alter_table("documentos_fiscais", schema=None) as batch_op:
+            batch_op.add_column(sa.Column("contingencia_em", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    columns = [c["name"] for c in inspector.get_columns("documentos_fiscais")]
+    if "contingencia_em" in columns:
+        with op.batch_alter_table("documentos_fiscais", schema=None) as batch_op:
+            batch_op.drop_column("contingencia_em")
@@ -0,0 +1,169 @@
+"""
+Benchmark: exportação de backup em streaming x carregando a tabela inteira.
+
+Sobe a aplicação contra um SQLite temporário (nada toca o banco real), semeia
+N itens de venda e mede, para cada modo, linhas/s e o pico de RSS acima do
+patamar do processo (amostrado a cada 5 ms):
+
+- streaming: backup_stream.exportar_zip (cursor + lotes → membro do ZIP);
+- legado:    query.all() + to_dict() + json.dumps num ZIP em memória, como
+             o /backup e o /backup/exportar faziam;
+- restauração: restaurar_zip do NDJSON gerado, num banco vazio.
+
+Uso:
+    python scripts/bench_backup_stream.py --itens 200000
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import date
+from decimal import Decimal
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(BASE_DIR)
+
+_TMP = tempfile.mkdtemp(prefix="bench_backup_")
+DATABASE_URI = f"sqlite:///{os.path.join(_TMP, 'bench.db')}"
+for key in ("DATABASE_URL", "AIVEN_DATABASE_URL", "POSTGRES_URL", "MAIN_DATABASE_URL"):
+    os.environ[key] = DATABASE_URI if key == "DATABASE_URL" else ""
+os.environ["FLASK_ENV"] = "simulation"
+os.environ["SKIP_DB_SETUP"] = "true"
+
+
+class PicoRSS:
+    """Amostra o RSS numa thread e guarda o pico acima do valor inicial."""
+
+    def __init__(self):
+        import psutil
+        self._processo = psutil.Process()
+        self._parar = threading.Event()
+        self.pico = 0
+
+    def __enter__(self):
+        self._base = self._processo.memory_info().rss
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+        self._thread.start()
+        return self
+
+    def _amostrar(self):
+        while not self._parar.wait(0.005):
+            self.pico = max(self.pico, self._processo.memory_info().rss - self._base)
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+
+def _semear(db, itens):
+    from app.models import CategoriaProduto, Estabelecimento, Funcionario, Produto, Venda, VendaItem
+
+    estab = Estabelecimento(
+        nome_fantasia="Loja Bench", razao_social="Loja Bench LTDA", cnpj="12345678000199",
+        email="bench@mercadinho.sys", telefone="92999999999", data_abertura=date(2024, 1, 1),
+        plano="PREMIUM", vencimento_plano=date(2030, 12, 31), cep="69000-000", logradouro="Rua A",
+        numero="1", bairro="Centro", cidade="Manaus", estado="AM", pais="Brasil",
+    )
+    db.session.add(estab)
+    db.session.flush()
+    admin = Funcionario(
+        estabelecimento_id=estab.id, nome="Bench", cpf="11122233344", username="bench", role="admin",
+        ativo=True, data_nascimento=date(1990, 1, 1), celular="92999999999", email="admin@bench.sys",
+        cargo="Gerente", data_admissao=date(2024, 1, 1), salario_base=Decimal("1000"),
+    )
+    admin.set_password("bench")
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Bebidas")
+    db.session.add_all([admin, cat])
+    db.session.flush()
+    prod = Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome="Refrigerante 2L",
+                   preco_custo=Decimal("5"), preco_venda=Decimal("8"), quantidade=100000)
+    db.session.add(prod)
+    db.session.commit()
+
+    por_venda = 5
+    vendas = [{"estabelecimento_id": estab.id, "funcionario_id": admin.id, "codigo": f"B{i:08d}",
+               "subtotal": Decimal("40"), "total": Decimal("40")} for i in range(itens // por_venda)]
+    db.session.execute(Venda.__table__.insert(), vendas)
+    venda_ids = [v for (v,) in db.session.execute(db.select(Venda.id).order_by(Venda.id))]
+    lote = []
+    for venda_id in venda_ids:
+        for _ in range(por_venda):
+            lote.append({"estabelecimento_id": estab.id, "venda_id": venda_id, "produto_id": prod.id,
+                         "produto_nome": "Refrigerante 2L", "quantidade": 1,
+                         "preco_unitario": Decimal("8"), "total_item": Decimal("8")})
+        if len(lote) >= 20000:
+            db.session.execute(VendaItem.__table__.insert(), lote)
+            lote = []
+    if lote:
+        db.session.execute(VendaItem.__table__.insert(), lote)
+    db.session.commit()
+    return estab.id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--itens", type=int, default=200000)
+    parser.add_argument("--sem-legado", action="store_true", help="Não roda o modo legado (pode estourar a RAM).")
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.models import db, Venda, VendaItem
+    from app.services import backup_stream
+
+    app = create_app("testing")
+    app.config.update(SQLALCHEMY_DATABASE_URI=DATABASE_URI, TESTING=True)
+    resultados = []
+
+    with app.app_context():
+        db.create_all()
+        estab_id = _semear(db, args.itens)
+        tabelas = ["vendas", "venda_itens"]
+        linhas = args.itens + args.itens // 5
+        db.session.remove()
+
+        for formato in ("csv", "ndjson"):
+            inicio = time.perf_counter()
+            with PicoRSS() as rss:
+                _, gerador = backup_stream.exportar_zip(estab_id, tabelas=tabelas, formato=formato)
+                tamanho = sum(len(bloco) for bloco in gerador)  # cliente lendo o stream
+            resultados.append((f"streaming {formato}", time.perf_counter() - inicio, rss.pico, tamanho))
+            db.session.remove()
+
+        caminho = os.path.join(_TMP, "backup.zip")
+        _, gerador = backup_stream.exportar_zip(estab_id, tabelas=tabelas, formato="ndjson")
+        backup_stream.gravar_zip(caminho, gerador)
+
+        if not args.sem_legado:
+            inicio = time.perf_counter()
+            with PicoRSS() as rss:
+                dados = {m.__tablename__: [o.to_dict() for o in m.query.filter_by(estabelecimento_id=estab_id).all()]
+                         for m in (Venda, VendaItem)}
+                buf = io.BytesIO()
+                with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                    zf.writestr("backup.json", json.dumps(dados, ensure_ascii=False, default=str))
+                tamanho = buf.tell()
+                del dados, buf
+            resultados.append(("legado (all+json)", time.perf_counter() - inicio, rss.pico, tamanho))
+            db.session.remove()
+
+        db.session.execute(VendaItem.__table__.delete())
+        db.session.execute(Venda.__table__.delete())
+        db.session.commit()
+        inicio = time.perf_counter()
+        with PicoRSS() as rss:
+            backup_stream.restaurar_zip(caminho)
+        resultados.append(("restauração ndjson", time.perf_counter() - inicio, rss.pico, os.path.getsize(caminho)))
+
+    print(f"[BENCH BACKUP] {linhas} linhas ({args.itens} itens de venda + vendas)")
+    for nome, duracao, pico, tamanho in resultados:
+        print(f"{nome:<20} {linhas / duracao:10.0f} linhas/s | pico RSS +{pico / 2**20:7.1f} MiB | "
+              f"{tamanho / 2**20:6.1f} MiB | {duracao:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
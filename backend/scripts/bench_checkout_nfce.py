@@ -0,0 +1,141 @@
+"""
+Benchmark: latência do checkout com emissão de NFC-e em linha x pela fila.
+
+Sobe a aplicação contra um SQLite temporário (nada toca o banco real), cria uma
+loja com um produto e finaliza N vendas com um gateway SIMULADO LENTO (latência
+configurável, como uma SEFAZ em horário de pico):
+
+- em linha: venda + emitir_nfce (o caixa espera o gateway);
+- fila:     venda + FilaEmissaoNFCe.enfileirar (o caixa não espera) e workers
+            esvaziando a fila em paralelo.
+
+Uso:
+    python scripts/bench_checkout_nfce.py --vendas 20 --latencia 0.8 --workers 4
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(BASE_DIR)
+
+_TMP = tempfile.mkdtemp(prefix="bench_nfce_")
+DATABASE_URI = f"sqlite:///{os.path.join(_TMP, 'bench.db')}"
+for key in ("DATABASE_URL", "AIVEN_DATABASE_URL", "POSTGRES_URL", "MAIN_DATABASE_URL"):
+    os.environ[key] = DATABASE_URI if key == "DATABASE_URL" else ""
+os.environ["FLASK_ENV"] = "simulation"
+os.environ["SKIP_DB_SETUP"] = "true"
+
+
+def _semear(db):
+    from app.models import CategoriaProduto, Configuracao, Estabelecimento, Funcionario, Produto
+
+    estab = Estabelecimento(
+        nome_fantasia="Loja Bench", razao_social="Loja Bench LTDA", cnpj="12345678000199",
+        email="bench@mercadinho.sys", telefone="92999999999", data_abertura=date(2024, 1, 1),
+        plano="PREMIUM", vencimento_plano=date(2030, 12, 31), cep="69000-000", logradouro="Rua A",
+        numero="1", bairro="Centro", cidade="Manaus", estado="AM", pais="Brasil",
+    )
+    db.session.add(estab)
+    db.session.flush()
+    admin = Funcionario(
+        estabelecimento_id=estab.id, nome="Bench", cpf="11122233344", username="bench", role="admin",
+        ativo=True, data_nascimento=date(1990, 1, 1), celular="92999999999", email="admin@bench.sys",
+        cargo="Gerente", data_admissao=date(2024, 1, 1), salario_base=Decimal("1000"),
+    )
+    admin.set_password("bench")
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Bebidas")
+    db.session.add_all([admin, cat, Configuracao(estabelecimento_id=estab.id)])
+    db.session.flush()
+    prod = Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome="Refrigerante 2L",
+                   preco_custo=Decimal("5"), preco_venda=Decimal("8"), quantidade=100000,
+                   ncm="22021000", cfop_padrao="5102", csosn="102")
+    db.session.add(prod)
+    db.session.commit()
+    return estab.id, admin.id, prod.id
+
+
+def _p95(valores):
+    ordenados = sorted(valores)
+    return ordenados[max(0, int(len(ordenados) * 0.95) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vendas", type=int, default=20)
+    parser.add_argument("--latencia", type=float, default=0.8, help="Latência simulada do gateway (s).")
+    parser.add_argument("--workers", type=int, default=4, help="Workers da fila.")
+    args = parser.parse_args()
+
+    from flask_jwt_extended import create_access_token
+
+    from app import create_app
+    from app.models import db, DocumentoFiscal, Estabelecimento, Venda
+    from app.services.fiscal import emissao_service, fila_emissao, gateways
+
+    app = create_app("testing")
+    app.config.update(SQLALCHEMY_DATABASE_URI=DATABASE_URI, TESTING=True)
+
+    emitir_original = gateways.SimuladoGateway.emitir
+
+    def emitir_lento(self, payload, referencia):
+        time.sleep(args.latencia)
+        return emitir_original(self, payload, referencia)
+
+    gateways.SimuladoGateway.emitir = emitir_lento
+
+    with app.app_context():
+        db.create_all()
+        estab_id, func_id, prod_id = _semear(db)
+        headers = {"Authorization": "Bearer " + create_access_token(
+            identity=str(func_id), additional_claims={"estabelecimento_id": estab_id})}
+        client = app.test_client()
+        venda_payload = {
+            "items": [{"productId": prod_id, "quantity": 1, "price": 8.0}],
+            "subtotal": 8.0, "total": 8.0, "pagamentos": [{"forma_pagamento": "dinheiro", "valor": 8.0}],
+        }
+
+        def checkout(emitir):
+            inicio = time.perf_counter()
+            resp = client.post("/api/vendas/", json=venda_payload, headers=headers)
+            body = resp.get_json() or {}
+            assert "venda" in body, body
+            venda = Venda.query.filter_by(codigo=body["venda"]["codigo"]).first()
+            emitir(venda, db.session.get(Estabelecimento, estab_id), func_id)
+            return time.perf_counter() - inicio
+
+        em_linha = [checkout(emissao_service.emitir_nfce) for _ in range(args.vendas)]
+
+        workers = [fila_emissao.FilaEmissaoWorker(app, i) for i in range(args.workers)]
+        inicio_fila = time.perf_counter()
+        for w in workers:
+            w.start()
+        pela_fila = [checkout(fila_emissao.FilaEmissaoNFCe.enfileirar) for _ in range(args.vendas)]
+        while DocumentoFiscal.query.filter(DocumentoFiscal.status.in_(("fila", "processando"))).count():
+            db.session.rollback()
+            fila_emissao._acordar.set()
+            time.sleep(0.05)
+        drenagem = time.perf_counter() - inicio_fila
+        autorizadas = DocumentoFiscal.query.filter_by(status="autorizado").count()
+        numeros = [int(n) for (n,) in db.session.query(DocumentoFiscal.numero).all()]
+
+    def linha(nome, valores):
+        return (f"{nome:<10} p50 {statistics.median(valores) * 1000:7.0f} ms | "
+                f"p95 {_p95(valores) * 1000:7.0f} ms | máx {max(valores) * 1000:7.0f} ms")
+
+    print(f"[BENCH NFC-e] {args.vendas} vendas por modo, gateway com {args.latencia:.2f}s de latência")
+    print(linha("em linha", em_linha))
+    print(linha("fila", pela_fila))
+    print(f"fila drenada por {args.workers} worker(s) em {drenagem:.2f}s; "
+          f"{autorizadas}/{2 * args.vendas} autorizadas; números únicos: {len(set(numeros)) == len(numeros)}")
+    threading.Event().wait(0)  # workers são daemon: encerram com o processo
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Benchmark de regressão: estatísticas de vendas numa loja sintética grande.
+
+Sobe a aplicação contra um SQLite temporário (nada toca o banco real), grava
+N vendas finalizadas (padrão: 1 milhão) espalhadas por --dias, com um item e um
+pagamento cada, e mede:
+
+- referência: o formato antigo (filtro em COALESCE(data_venda, created_at),
+  um agregado por tabela, dia e hora em consultas separadas e regressão em
+  Python puro) executado direto no banco;
+- as rotas atuais /api/vendas/estatisticas, /analise-tendencia e
+  /relatorio-diario pelo test client.
+
+Com --limite-ms o script sai com código 1 se o p50 de alguma rota passar do
+limite (uso em CI noturno).
+
+Uso:
+    python scripts/bench_estatisticas_vendas.py --vendas 1000000 --dias 365 --repeticoes 5
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(BASE_DIR)
+
+_TMP = tempfile.mkdtemp(prefix="bench_estatisticas_")
+DATABASE_URI = f"sqlite:///{os.path.join(_TMP, 'bench.db')}"
+for key in ("DATABASE_URL", "AIVEN_DATABASE_URL", "POSTGRES_URL", "MAIN_DATABASE_URL"):
+    os.environ[key] = DATABASE_URI if key == "DATABASE_URL" else ""
+os.environ["FLASK_ENV"] = "simulation"
+os.environ["SKIP_DB_SETUP"] = "true"
+
+_LOTE = 50_000
+_FORMAS = ("dinheiro", "pix", "cartao_credito", "cartao_debito")
+
+
+def _semear_loja(db):
+    from app.models import CategoriaProduto, Configuracao, Estabelecimento, Funcionario, Produto
+
+    estab = Estabelecimento(
+        nome_fantasia="Loja Bench", razao_social="Loja Bench LTDA", cnpj="12345678000199",
+        email="bench@mercadinho.sys", telefone="92999999999", data_abertura=date(2024, 1, 1),
+        plano="Pro", vencimento_plano=date(2030, 12, 31), cep="69000-000", logradouro="Rua A",
+        numero="1", bairro="Centro", cidade="Manaus", estado="AM", pais="Brasil",
+    )
+    db.session.add(estab)
+    db.session.flush()
+    admin = Funcionario(
+        estabelecimento_id=estab.id, nome="Bench", cpf="11122233344", username="bench", role="admin",
+        ativo=True, data_nascimento=date(1990, 1, 1), celular="92999999999", email="admin@bench.sys",
+        cargo="Gerente", data_admissao=date(2024, 1, 1), salario_base=Decimal("1000"),
+    )
+    admin.set_password("bench")
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Mercearia")
+    db.session.add_all([admin, cat, Configuracao(estabelecimento_id=estab.id)])
+    db.session.flush()
+    produtos = [Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome=f"Produto {i}",
+                        preco_custo=Decimal("3"), preco_venda=Decimal("5"), quantidade=10 ** 9)
+                for i in range(50)]
+    db.session.add_all(produtos)
+    db.session.commit()
+    return estab.id, admin.id, [p.id for p in produtos]
+
+
+def _semear_vendas(db, estab_id, func_id, produto_ids, total_vendas, dias):
+    """INSERT em lote (Core) de vendas, itens e pagamentos; ids atribuídos aqui."""
+    from app.models import Pagamento, Venda, VendaItem
+
+    rng = random.Random(42)
+    fim = datetime.utcnow()
+    conn = db.session.connection()
+    for inicio_lote in range(0, total_vendas, _LOTE):
+        vendas, itens, pagamentos = [], [], []
+        for vid in range(inicio_lote + 1, min(total_vendas, inicio_lote + _LOTE) + 1):
+            quando = fim - timedelta(days=rng.random() * dias)
+            total = round(rng.uniform(3, 300), 2)
+            vendas.append({
+                "id": vid, "estabelecimento_id": estab_id, "funcionario_id": func_id, "codigo": f"B{vid}",
+                "subtotal": total, "desconto": 0, "total": total, "valor_recebido": total, "troco": 0,
+                "status": "finalizada" if vid % 50 else "cancelada", "quantidade_itens": 1,
+                "data_venda": quando, "created_at": quando, "updated_at": quando, "sync_uuid": str(uuid.uuid4()),
+            })
+            itens.append({
+                "id": vid, "estabelecimento_id": estab_id, "venda_id": vid, "produto_id": rng.choice(produto_ids),
+                "produto_nome": "Produto", "quantidade": 1, "preco_unitario": total, "total_item": total,
+                "margem_lucro_real": round(total * 0.3, 2), "created_at": quando, "updated_at": quando,
+                "sync_uuid": str(uuid.uuid4()),
+            })
+            pagamentos.append({
+                "id": vid, "estabelecimento_id": estab_id, "venda_id": vid, "forma_pagamento": rng.choice(_FORMAS),
+                "valor": total, "status": "aprovado", "data_pagamento": quando, "created_at": quando,
+                "updated_at": quando,
+            })
+        conn.execute(Venda.__table__.insert(), vendas)
+        conn.execute(VendaItem.__table__.insert(), itens)
+        conn.execute(Pagamento.__table__.insert(), pagamentos)
+        db.session.commit()
+        conn = db.session.connection()
+    db.session.execute(db.text("ANALYZE"))
+    db.session.commit()
+
+
+def _referencia(db, estab_id, inicio, fim):
+    """Formato antigo: COALESCE no filtro, agregados separados, regressão em Python."""
+    filtro = ("SELECT id FROM vendas WHERE estabelecimento_id = :e AND status = 'finalizada' "
+              "AND COALESCE(data_venda, created_at) >= :i AND COALESCE(data_venda, created_at) <= :f")
+    p = {"e": estab_id, "i": inicio, "f": fim}
+    db.session.execute(db.text(f"SELECT COUNT(id), SUM(total) FROM vendas WHERE id IN ({filtro})"), p).all()
+    db.session.execute(db.text(
+        f"SELECT SUM(margem_lucro_real), SUM(quantidade) FROM venda_itens WHERE venda_id IN ({filtro})"), p).all()
+    dias = db.session.execute(db.text(
+        f"SELECT date(COALESCE(data_venda, created_at)) d, COUNT(id), SUM(total) FROM vendas "
+        f"WHERE id IN ({filtro}) GROUP BY d ORDER BY d"), p).all()
+    db.session.execute(db.text(
+        f"SELECT strftime('%H', COALESCE(data_venda, created_at)) h, COUNT(id), SUM(total) FROM vendas "
+        f"WHERE id IN ({filtro}) GROUP BY h"), p).all()
+    y = [float(d[2] or 0) for d in dias]
+    n = len(y)
+    if n > 1:
+        mx, my = (n - 1) / 2, sum(y) / n
+        sum((i - mx) * (v - my) for i, v in enumerate(y)) / sum((i - mx) ** 2 for i in range(n))
+
+
+def _medir(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vendas", type=int, default=1_000_000)
+    parser.add_argument("--dias", type=int, default=365, help="Janela de datas das vendas sintéticas.")
+    parser.add_argument("--periodo", type=int, default=30, help="Dias consultados pelas estatísticas.")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--limite-ms", type=float, default=None, help="Falha se o p50 de uma rota passar disto.")
+    args = parser.parse_args()
+
+    from flask_jwt_extended import create_access_token
+
+    from app import create_app
+    from app.models import db
+
+    app = create_app("testing")
+    app.config.update(SQLALCHEMY_DATABASE_URI=DATABASE_URI, TESTING=True)
+
+    with app.app_context():
+        db.create_all()
+        estab_id, func_id, produto_ids = _semear_loja(db)
+        t0 = time.perf_counter()
+        _semear_vendas(db, estab_id, func_id, produto_ids, args.vendas, args.dias)
+        print(f"[BENCH ESTATÍSTICAS] {args.vendas} vendas gravadas em {time.perf_counter() - t0:.1f}s")
+
+        headers = {"Authorization": "Bearer " + create_access_token(
+            identity=str(func_id), additional_claims={"estabelecimento_id": estab_id, "role": "admin"})}
+        client = app.test_client()
+        fim = datetime.utcnow()
+        inicio = fim - timedelta(days=args.periodo)
+
+        def rota(url, **query):
+            def _chamar():
+                resp = client.get(url, headers=headers, query_string=query)
+                assert resp.status_code == 200, resp.get_data(as_text=True)[:300]
+            return _chamar
+
+        medicoes = {
+            "referência (SQL antigo)": _medir(lambda: _referencia(db, estab_id, inicio, fim), args.repeticoes),
+            "/estatisticas": _medir(rota("/api/vendas/estatisticas", data_inicio=inicio.isoformat(),
+                                         data_fim=fim.isoformat()), args.repeticoes),
+            "/analise-tendencia": _medir(rota("/api/vendas/analise-tendencia", periodo="semanal", meses=6),
+                                         args.repeticoes),
+            "/relatorio-diario": _medir(rota("/api/vendas/relatorio-diario", data=fim.strftime("%Y-%m-%d")),
+                                        args.repeticoes),
+        }
+
+    estourou = False
+    for nome, tempos in medicoes.items():
+        p50 = statistics.median(tempos) * 1000
+        print(f"{nome:<26} p50 {p50:8.0f} ms | máx {max(tempos) * 1000:8.0f} ms")
+        if args.limite_ms and nome.startswith("/") and p50 > args.limite_ms:
+            estourou = True
+    if estourou:
+        print(f"REGRESSÃO: rota acima de {args.limite_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
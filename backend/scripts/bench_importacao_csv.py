@@ -0,0 +1,198 @@
+"""
+Benchmark: importação de CSV em massa (importacao_service) x ORM linha a linha.
+
+Sobe a aplicação contra um SQLite temporário (nada toca o banco real), gera
+CSVs de produtos e clientes com N linhas (por padrão 10k e 100k, com ~2% de
+duplicados e ~1% de linhas inválidas) e mede, para cada tamanho:
+
+- em massa: ImportacaoService.agendar + processamento em linha (blocos de
+  _LOTE, uma consulta de duplicados e um INSERT ... ON CONFLICT por bloco);
+- simulação: o mesmo com simular=true (só leitura);
+- legado:    uma consulta de existência + add + flush por linha, commit a
+             cada 50 — o padrão do /importar antigo (só no menor tamanho,
+             ou com --legado-em-todos).
+
+Uso:
+    python scripts/bench_importacao_csv.py --linhas 10000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+from decimal import Decimal
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(BASE_DIR)
+
+_TMP = tempfile.mkdtemp(prefix="bench_importacao_")
+DATABASE_URI = f"sqlite:///{os.path.join(_TMP, 'bench.db')}"
+for key in ("DATABASE_URL", "AIVEN_DATABASE_URL", "POSTGRES_URL", "MAIN_DATABASE_URL"):
+    os.environ[key] = DATABASE_URI if key == "DATABASE_URL" else ""
+os.environ["FLASK_ENV"] = "simulation"
+os.environ["SKIP_DB_SETUP"] = "true"
+
+
+class Upload:
+    """Imita o FileStorage do Flask para um arquivo já em disco."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.filename = os.path.basename(caminho)
+
+    def save(self, destino):
+        import shutil
+        shutil.copyfile(self.caminho, destino)
+
+
+def _cpf(n: int) -> str:
+    base = [int(d) for d in f"{n:09d}"]
+    for _ in range(2):
+        soma = sum(d * p for d, p in zip(base, range(len(base) + 1, 1, -1)))
+        base.append(0 if soma % 11 < 2 else 11 - soma % 11)
+    return "".join(map(str, base))
+
+
+def _gerar_csv(tipo: str, linhas: int) -> str:
+    caminho = os.path.join(_TMP, f"{tipo}_{linhas}.csv")
+    aleatorio = random.Random(linhas)
+    with open(caminho, "w", encoding="utf-8", newline="") as f:
+        if tipo == "produtos":
+            f.write("nome;categoria;ean;codigo_interno;preco_custo;preco_venda;estoque;validade\n")
+            for i in range(linhas):
+                j = i - 1 if i and aleatorio.random() < 0.02 else i  # duplicado no arquivo
+                preco = "" if aleatorio.random() < 0.01 else f"{5 + i % 50},90"  # inválida
+                f.write(f"Produto {i};Categoria {i % 40};789{j:010d};P{j:07d};3,10;{preco};{i % 30};"
+                        f"{date(2027, 1 + i % 12, 1).strftime('%d/%m/%Y')}\n")
+        else:
+            f.write("nome;cpf;celular;email;limite_credito;saldo_devedor\n")
+            for i in range(linhas):
+                j = i - 1 if i and aleatorio.random() < 0.02 else i
+                cpf = "123" if aleatorio.random() < 0.01 else _cpf(100000 + j)
+                f.write(f"Cliente {i};{cpf};9299{i:07d};c{i}@bench.sys;500;{(i % 5) * 10}\n")
+    return caminho
+
+
+def _semear(db):
+    from app.models import Estabelecimento, Funcionario
+
+    estab = Estabelecimento(
+        nome_fantasia="Loja Bench", razao_social="Loja Bench LTDA", cnpj="12345678000199",
+        email="bench@mercadinho.sys", telefone="92999999999", data_abertura=date(2024, 1, 1),
+        plano="PREMIUM", vencimento_plano=date(2030, 12, 31), cep="69000-000", logradouro="Rua A",
+        numero="1", bairro="Centro", cidade="Manaus", estado="AM", pais="Brasil",
+    )
+    db.session.add(estab)
+    db.session.flush()
+    admin = Funcionario(
+        estabelecimento_id=estab.id, nome="Bench", cpf="11122233344", username="bench", role="admin",
+        ativo=True, data_nascimento=date(1990, 1, 1), celular="92999999999", email="admin@bench.sys",
+        cargo="Gerente", data_admissao=date(2024, 1, 1), salario_base=Decimal("1000"),
+    )
+    admin.set_password("bench")
+    db.session.add(admin)
+    db.session.commit()
+    return estab.id, admin.id
+
+
+def _legado(db, tipo, caminho, estab_id):
+    """Padrão do /importar antigo: SELECT de existência + add + flush por linha."""
+    import csv
+    from app.models import CategoriaProduto, Cliente, Produto
+
+    categorias, ok = {}, 0
+    with open(caminho, encoding="utf-8", newline="") as f:
+        for n, linha in enumerate(csv.DictReader(f, delimiter=";"), start=1):
+            try:
+                if tipo == "produtos":
+                    if not linha["preco_venda"] or db.session.query(Produto.id).filter_by(
+                            estabelecimento_id=estab_id, codigo_barras=linha["ean"]).first():
+                        continue
+                    if linha["categoria"] not in categorias:
+                        cat = CategoriaProduto.query.filter_by(estabelecimento_id=estab_id,
+                                                               nome=linha["categoria"]).first()
+                        if not cat:
+                            cat = CategoriaProduto(estabelecimento_id=estab_id, nome=linha["categoria"])
+                            db.session.add(cat)
+                            db.session.flush()
+                        categorias[linha["categoria"]] = cat.id
+                    db.session.add(Produto(
+                        estabelecimento_id=estab_id, categoria_id=categorias[linha["categoria"]], nome=linha["nome"],
+                        codigo_barras=linha["ean"], codigo_interno=linha["codigo_interno"],
+                        preco_custo=Decimal(linha["preco_custo"].replace(",", ".")),
+                        preco_venda=Decimal(linha["preco_venda"].replace(",", ".")), quantidade=int(linha["estoque"])))
+                else:
+                    if len(linha["cpf"]) != 11 or db.session.query(Cliente.id).filter_by(
+                            estabelecimento_id=estab_id, cpf=linha["cpf"]).first():
+                        continue
+                    db.session.add(Cliente(
+                        estabelecimento_id=estab_id, nome=linha["nome"], cpf=linha["cpf"], celular=linha["celular"],
+                        email=linha["email"], limite_credito=Decimal(linha["limite_credito"]), cep="00000-000",
+                        logradouro="Não informado", numero="S/N", bairro="Não informado", cidade="Manaus",
+                        estado="AM"))
+                db.session.flush()
+                ok += 1
+                if ok % 50 == 0:
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+    db.session.commit()
+    return ok
+
+
+def _zerar(db):
+    from app.models import CategoriaProduto, Cliente, ContaReceber, Produto, ProdutoLote
+
+    for modelo in (ProdutoLote, ContaReceber, Produto, CategoriaProduto, Cliente):
+        db.session.execute(modelo.__table__.delete())
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--legado-em-todos", action="store_true",
+                        help="Roda o modo legado também nos arquivos grandes (lento).")
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.models import db
+    from app.services.importacao_service import ImportacaoService
+
+    app = create_app("testing")
+    app.config.update(SQLALCHEMY_DATABASE_URI=DATABASE_URI, TESTING=True,
+                      IMPORTACAO_FOLDER=os.path.join(_TMP, "spool"))
+    resultados = []
+
+    with app.app_context():
+        db.create_all()
+        estab_id, admin_id = _semear(db)
+        for linhas in args.linhas:
+            for tipo in ("produtos", "clientes"):
+                caminho = _gerar_csv(tipo, linhas)
+                for modo in ("simulação", "em massa"):
+                    inicio = time.perf_counter()
+                    job = ImportacaoService.agendar(tipo, Upload(caminho), estab_id, admin_id,
+                                                    simulacao=modo == "simulação")
+                    duracao = time.perf_counter() - inicio
+                    resultados.append((linhas, tipo, modo, duracao, job.inseridos, job.rejeitados))
+                    db.session.remove()
+                if args.legado_em_todos or linhas == min(args.linhas):
+                    _zerar(db)
+                    inicio = time.perf_counter()
+                    ok = _legado(db, tipo, caminho, estab_id)
+                    resultados.append((linhas, tipo, "legado", time.perf_counter() - inicio, ok, None))
+                    db.session.remove()
+                _zerar(db)
+
+    print("[BENCH IMPORTAÇÃO CSV] SQLite temporário, importação em linha (sem workers)")
+    for linhas, tipo, modo, duracao, ok, erros in resultados:
+        erros = "-" if erros is None else erros
+        print(f"{linhas:>7} {tipo:<9} {modo:<10} {linhas / duracao:9.0f} linhas/s | {duracao:7.2f}s | "
+              f"gravadas {ok:>7} | erros {erros}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Benchmark do particionamento mensal (Postgres) com 10M+ linhas.
+
+Exige um banco Postgres DESCARTÁVEL (--database-url + --banco-descartavel): o
+script cria o schema do zero, grava --vendas vendas com um item e um pagamento
+cada (padrão 4M → 12M linhas) espalhadas por --dias via generate_series, mede
+as consultas de janela recente (giro de 90 dias, top produtos e vendas por
+hora de 30 dias, formas de pagamento do mês) nas tabelas comuns, converte
+vendas/venda_itens/pagamentos com ParticionamentoService.converter e mede de
+novo. O EXPLAIN da consulta de giro mostra quantas partições o planner leu.
+
+Uso:
+    python scripts/bench_particionamento.py --database-url postgresql://u:s@localhost/bench \\
+        --banco-descartavel --vendas 4000000 --dias 730 --repeticoes 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(BASE_DIR)
+
+_LOTE = 1_000_000
+
+
+def _configurar_ambiente(url):
+    for key in ("DATABASE_URL", "AIVEN_DATABASE_URL", "POSTGRES_URL", "MAIN_DATABASE_URL"):
+        os.environ[key] = url if key == "DATABASE_URL" else ""
+    os.environ["FLASK_ENV"] = "simulation"
+    os.environ["SKIP_DB_SETUP"] = "true"
+
+
+def _semear_loja(db):
+    from app.models import CategoriaProduto, Configuracao, Estabelecimento, Funcionario, Produto
+
+    estab = Estabelecimento(
+        nome_fantasia="Loja Bench", razao_social="Loja Bench LTDA", cnpj="12345678000199",
+        email="bench@mercadinho.sys", telefone="92999999999", data_abertura=date(2024, 1, 1),
+        plano="Pro", vencimento_plano=date(2030, 12, 31), cep="69000-000", logradouro="Rua A",
+        numero="1", bairro="Centro", cidade="Manaus", estado="AM", pais="Brasil",
+    )
+    db.session.add(estab)
+    db.session.flush()
+    admin = Funcionario(
+        estabelecimento_id=estab.id, nome="Bench", cpf="11122233344", username="bench", role="admin",
+        ativo=True, data_nascimento=date(1990, 1, 1), celular="92999999999", email="admin@bench.sys",
+        cargo="Gerente", data_admissao=date(2024, 1, 1), salario_base=Decimal("1000"),
+    )
+    admin.set_password("bench")
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Mercearia")
+    db.session.add_all([admin, cat, Configuracao(estabelecimento_id=estab.id)])
+    db.session.flush()
+    produtos = [Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome=f"Produto {i}",
+                        preco_custo=Decimal("3"), preco_venda=Decimal("5"), quantidade=10 ** 9)
+                for i in range(200)]
+    db.session.add_all(produtos)
+    db.session.commit()
+    return estab.id, admin.id, [p.id for p in produtos]
+
+
+def _semear_vendas(db, estab_id, func_id, produto_ids, total_vendas, dias):
+    """generate_series no próprio Postgres: filhos herdam a data da venda."""
+    p = {"e": estab_id, "f": func_id, "dias": dias, "pmin": min(produto_ids), "np": len(produto_ids)}
+    for inicio in range(1, total_vendas + 1, _LOTE):
+        p.update(a=inicio, b=min(total_vendas, inicio + _LOTE - 1))
+        db.session.execute(db.text(
+            "INSERT INTO vendas (id, estabelecimento_id, funcionario_id, codigo, subtotal, desconto, total, "
+            "valor_recebido, troco, status, quantidade_itens, tipo_venda, data_venda, created_at, updated_at, sync_uuid) "
+            "SELECT g, :e, :f, 'B' || g, t, 0, t, t, 0, "
+            "CASE WHEN g % 50 = 0 THEN 'cancelada' ELSE 'finalizada' END, 1, 'balcao', q, q, q, md5(g::text) "
+            "FROM (SELECT g, now() - random() * :dias * interval '1 day' AS q, "
+            "round((3 + random() * 297)::numeric, 2) AS t FROM generate_series(:a, :b) g) s"), p)
+        db.session.execute(db.text(
+            "INSERT INTO venda_itens (id, estabelecimento_id, venda_id, produto_id, produto_nome, quantidade, "
+            "preco_unitario, total_item, custo_unitario, margem_lucro_real, created_at, updated_at, sync_uuid) "
+            "SELECT id, estabelecimento_id, id, :pmin + (id % :np), 'Produto', 1, total, total, total * 0.7, "
+            "total * 0.3, data_venda, data_venda, md5('i' || id) FROM vendas WHERE id BETWEEN :a AND :b"), p)
+        db.session.execute(db.text(
+            "INSERT INTO pagamentos (id, estabelecimento_id, venda_id, forma_pagamento, valor, status, "
+            "data_pagamento, created_at, updated_at) "
+            "SELECT id, estabelecimento_id, id, (ARRAY['dinheiro','pix','cartao_credito','cartao_debito'])[1 + id % 4], "
+            "total, 'aprovado', data_venda, data_venda, data_venda FROM vendas WHERE id BETWEEN :a AND :b"), p)
+        db.session.commit()
+        print(f"  ... {p['b']} vendas")
+    for seq in ("vendas_id_seq", "venda_itens_id_seq", "pagamentos_id_seq"):
+        db.session.execute(db.text(f"SELECT setval('{seq}', :n)"), {"n": total_vendas})
+    db.session.commit()
+
+
+def _analisar(db):
+    db.session.execute(db.text("ANALYZE vendas, venda_itens, pagamentos"))
+    db.session.commit()
+
+
+def _medir(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos) * 1000
+
+
+def _consultas(estab_id):
+    from app.dashboard_cientifico.data_layer import DataLayer
+    from app.utils import giro_cache
+
+    fim = datetime.utcnow()
+
+    def giro():
+        giro_cache._cache.clear()
+        assert giro_cache.get_vendas_agregadas(estab_id)
+
+    return {
+        "giro 90 dias": giro,
+        "top produtos 30 dias": lambda: DataLayer.get_top_products(estab_id, 30),
+        "vendas por hora 30 dias": lambda: DataLayer.get_sales_by_hour(estab_id, 30),
+        "formas de pagamento do mês": lambda: DataLayer.get_payment_methods_metrics(
+            estab_id, fim - timedelta(days=30), fim),
+    }
+
+
+def _particoes_lidas(db, estab_id):
+    """Partições de venda_itens tocadas pelo plano da consulta de giro."""
+    from sqlalchemy.dialects import postgresql
+    from app.models import Venda, VendaItem, janela_particionada
+    from sqlalchemy import func
+
+    inicio = datetime.utcnow() - timedelta(days=90)
+    q = db.session.query(VendaItem.produto_id, func.sum(VendaItem.quantidade)).join(Venda).filter(
+        Venda.estabelecimento_id == estab_id, Venda.data_venda >= inicio,
+        *janela_particionada(VendaItem, inicio)).group_by(VendaItem.produto_id)
+    sql = str(q.statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    plano = [linha[0] for linha in db.session.execute(db.text("EXPLAIN " + sql))]
+    return sorted({tok for linha in plano for tok in linha.split() if tok.startswith("venda_itens_p")})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="Postgres descartável (o schema é recriado).")
+    parser.add_argument("--banco-descartavel", action="store_true", help="Confirma que o banco pode ser apagado.")
+    parser.add_argument("--vendas", type=int, default=4_000_000, help="Vendas (cada uma gera 3 linhas).")
+    parser.add_argument("--dias", type=int, default=730)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    if not args.database_url.startswith("postgres"):
+        sys.exit("Particionamento nativo exige Postgres (--database-url postgresql://...).")
+    if not args.banco_descartavel:
+        sys.exit("O banco informado será APAGADO: confirme com --banco-descartavel.")
+    _configurar_ambiente(args.database_url)
+
+    from app import create_app
+    from app.models import db
+    from app.services.particionamento_service import ParticionamentoService
+
+    app = create_app("testing")
+    app.config.update(SQLALCHEMY_DATABASE_URI=args.database_url, TESTING=True)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        estab_id, func_id, produto_ids = _semear_loja(db)
+        t0 = time.perf_counter()
+        _semear_vendas(db, estab_id, func_id, produto_ids, args.vendas, args.dias)
+        _analisar(db)
+        print(f"[BENCH PARTIÇÕES] {args.vendas * 3} linhas gravadas em {time.perf_counter() - t0:.0f}s")
+
+        consultas = _consultas(estab_id)
+        antes = {nome: _medir(f, args.repeticoes) for nome, f in consultas.items()}
+
+        t0 = time.perf_counter()
+        for tabela in ("vendas", "venda_itens", "pagamentos"):
+            res = ParticionamentoService.converter(tabela)
+            print(f"  {tabela}: {res['linhas']} linha(s), {res['particoes']} partição(ões)")
+        _analisar(db)
+        print(f"[BENCH PARTIÇÕES] conversão em {time.perf_counter() - t0:.0f}s")
+
+        depois = {nome: _medir(f, args.repeticoes) for nome, f in consultas.items()}
+        lidas = _particoes_lidas(db, estab_id)
+        total = len(ParticionamentoService.listar("venda_itens"))
+
+    print(f"{'consulta':<28}{'comum':>10}{'particionada':>15}")
+    for nome in consultas:
+        print(f"{nome:<28}{antes[nome]:>8.0f}ms{depois[nome]:>13.0f}ms")
+    print(f"giro 90 dias lê {len(lidas)} de {total} partições de venda_itens: {', '.join(lidas)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark: latência da autorização por PIN x quantidade de admins/gerentes.
+
+Sobe a aplicação contra um SQLite temporário (nada toca o banco real), cria
+uma loja com N autorizadores (por padrão 1, 5, 15 e 30), cada um com seu PIN,
+e mede por tentativa:
+
+- legado:   carrega todos os candidatos do tenant e testa o hash de cada um
+            até acertar (o autorizar_por_pin/estorno antigos);
+- indexado: PinService.autorizar — busca por (estabelecimento_id, pin_busca)
+            e um único hash no candidato encontrado.
+
+Para cada modo mede um PIN certo (dono sorteado entre os N) e um PIN errado,
+que no legado custa N hashes e no indexado nenhum. O bloqueio por tentativas
+fica desligado (limite alto) para não interferir na medição.
+
+Uso:
+    python scripts/bench_pin_autorizacao.py --gerentes 1 5 15 30 --tentativas 20
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+from decimal import Decimal
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(BASE_DIR)
+
+_TMP = tempfile.mkdtemp(prefix="bench_pin_")
+DATABASE_URI = f"sqlite:///{os.path.join(_TMP, 'bench.db')}"
+for key in ("DATABASE_URL", "AIVEN_DATABASE_URL", "POSTGRES_URL", "MAIN_DATABASE_URL"):
+    os.environ[key] = DATABASE_URI if key == "DATABASE_URL" else ""
+os.environ["FLASK_ENV"] = "simulation"
+os.environ["SKIP_DB_SETUP"] = "true"
+os.environ["PIN_MAX_TENTATIVAS"] = "1000000"
+
+
+def _semear(db, gerentes):
+    from app.models import Estabelecimento, Funcionario
+
+    estab = Estabelecimento(
+        nome_fantasia=f"Loja Bench {gerentes}", razao_social="Loja Bench LTDA", cnpj=f"12345678{gerentes:06d}",
+        email=f"bench{gerentes}@mercadinho.sys", telefone="92999999999", data_abertura=date(2024, 1, 1),
+        plano="PREMIUM", vencimento_plano=date(2030, 12, 31), cep="69000-000", logradouro="Rua A",
+        numero="1", bairro="Centro", cidade="Manaus", estado="AM", pais="Brasil",
+    )
+    db.session.add(estab)
+    db.session.flush()
+    pins = []
+    for i in range(gerentes):
+        func = Funcionario(
+            estabelecimento_id=estab.id, nome=f"Gerente {i}", cpf=f"{gerentes:03d}{i:08d}", username=f"g{gerentes}_{i}",
+            role="gerente", nivel_acesso=1 if i == 0 else 2, ativo=True, data_nascimento=date(1990, 1, 1),
+            celular="92999999999", email=f"g{gerentes}_{i}@bench.sys", cargo="Gerente",
+            data_admissao=date(2024, 1, 1), salario_base=Decimal("1000"),
+        )
+        func.set_password("bench")
+        func.set_pin(f"{100000 + i}")
+        db.session.add(func)
+        pins.append(f"{100000 + i}")
+    db.session.commit()
+    return estab.id, pins
+
+
+def _legado(estab_id, pin):
+    """Regra antiga: todos os candidatos do tenant, um hash por candidato até acertar."""
+    from app.models import Funcionario
+
+    candidatos = Funcionario.query.filter(
+        Funcionario.estabelecimento_id == estab_id,
+        Funcionario.pin_cancelamento.isnot(None),
+        Funcionario.nivel_acesso <= 2,
+    ).all()
+    return next((f for f in candidatos if f.check_pin(pin)), None)
+
+
+def _medir(funcao, estab_id, pins, tentativas):
+    aleatorio = random.Random(len(pins))
+    certos, errados = [], []
+    for _ in range(tentativas):
+        inicio = time.perf_counter()
+        assert funcao(estab_id, aleatorio.choice(pins)) is not None
+        certos.append(time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+        assert funcao(estab_id, "999999") is None
+        errados.append(time.perf_counter() - inicio)
+    return statistics.median(certos) * 1000, statistics.median(errados) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gerentes", type=int, nargs="+", default=[1, 5, 15, 30])
+    parser.add_argument("--tentativas", type=int, default=20)
+    args = parser.parse_args()
+
+    from flask import g
+    from app import create_app
+    from app.models import db
+    from app.services.pin_service import PinService
+
+    app = create_app("testing")
+    app.config.update(SQLALCHEMY_DATABASE_URI=DATABASE_URI, TESTING=True, PIN_PEPPER="bench-pepper")
+    resultados = []
+
+    with app.test_request_context():
+        db.create_all()
+        for gerentes in args.gerentes:
+            estab_id, pins = _semear(db, gerentes)
+            g.estabelecimento_id = estab_id  # guard multi-tenant, como num request autenticado
+            for modo, funcao in (("legado", _legado), ("indexado", PinService.autorizar)):
+                certo, errado = _medir(funcao, estab_id, pins, args.tentativas)
+                resultados.append((gerentes, modo, certo, errado))
+                db.session.remove()
+
+    print("[BENCH PIN] SQLite temporário, mediana por tentativa (hash padrão do werkzeug)")
+    for gerentes, modo, certo, errado in resultados:
+        print(f"{gerentes:>4} autorizadores {modo:<9} PIN certo {certo:8.1f} ms | PIN errado {errado:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Microbenchmark: resolução do View Schema e validação de atributos.
+
+Sobe a aplicação contra um SQLite temporário (nada toca o banco real), cria uma
+loja com overrides e mede, por chamada:
+
+- montagem:   a cascata completa (seed do registry + varredura + overrides),
+              que era o caminho de toda requisição após o TTL do cache antigo;
+- compartilhado: artefato vindo do cache da aplicação (outro worker compilou;
+              só desserializa o JSON);
+- memória:    hit no LRU do processo (só lê os carimbos de versão);
+- sanitizar:  sanitizar_atributos com os índices do artefato x reindexando o
+              schema a cada chamada.
+
+Uso:
+    python scripts/bench_view_schema.py --repeticoes 2000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(BASE_DIR)
+
+_TMP = tempfile.mkdtemp(prefix="bench_view_schema_")
+DATABASE_URI = f"sqlite:///{os.path.join(_TMP, 'bench.db')}"
+for key in ("DATABASE_URL", "AIVEN_DATABASE_URL", "POSTGRES_URL", "MAIN_DATABASE_URL"):
+    os.environ[key] = DATABASE_URI if key == "DATABASE_URL" else ""
+os.environ["FLASK_ENV"] = "simulation"
+os.environ["SKIP_DB_SETUP"] = "true"
+
+
+def _semear(db):
+    from app.models import Estabelecimento
+
+    estab = Estabelecimento(
+        nome_fantasia="Loja Bench", razao_social="Loja Bench LTDA", cnpj="12345678000199",
+        email="bench@mercadinho.sys", telefone="92999999999", data_abertura=date(2024, 1, 1),
+        plano="PREMIUM", vencimento_plano=date(2030, 12, 31), cep="69000-000", logradouro="Rua A",
+        numero="1", bairro="Centro", cidade="Manaus", estado="AM", pais="Brasil", segmento="mercearia",
+    )
+    estab.configuracoes = {"view_schema": {"campos_ocultos": ["marca"], "obrigatorios": {"ncm": True}}}
+    db.session.add(estab)
+    db.session.commit()
+    return estab
+
+
+def _medir(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticoes", type=int, default=2000)
+    args = parser.parse_args()
+
+    from app import cache, create_app
+    from app.models import db
+    from app.services import view_schema_service as vs
+
+    app = create_app("testing")
+    app.config.update(SQLALCHEMY_DATABASE_URI=DATABASE_URI, TESTING=True)
+
+    with app.app_context():
+        db.create_all()
+        estab = _semear(db)
+        vs.garantir_registry_seed()
+        n = args.repeticoes
+
+        montagem = _medir(lambda: vs._montar_view_schema(estab, familia_produto="alimento"), max(1, n // 10))
+
+        def _compartilhado():
+            with vs._artefatos_lock:
+                vs._artefatos.clear()
+            vs.compilar_view_schema(estab, familia_produto="alimento")
+        vs.compilar_view_schema(estab, familia_produto="alimento")
+        compartilhado = _medir(_compartilhado, n)
+        memoria = _medir(lambda: vs.compilar_view_schema(estab, familia_produto="alimento"), n)
+
+        schema = vs.resolver_view_schema(estab, familia_produto="vestuario")
+        atributos = {"tamanho": "M", "cor": " Azul ", "desconhecido": 1, "material": ""}
+        com_indice = _medir(lambda: vs.sanitizar_atributos(schema, atributos), n)
+        copia = dict(schema)  # outro objeto: obriga a reindexar os campos
+        sem_indice = _medir(lambda: vs.sanitizar_atributos(copia, atributos), n)
+        cache.clear()
+
+    def linha(nome, valores):
+        return f"{nome:<22} p50 {statistics.median(valores) * 1e6:9.1f} µs | máx {max(valores) * 1e6:9.1f} µs"
+
+    print(f"[BENCH VIEW SCHEMA] {args.repeticoes} repetições por cenário")
+    print(linha("montagem (sem cache)", montagem))
+    print(linha("artefato compartilhado", compartilhado))
+    print(linha("artefato em memória", memoria))
+    print(linha("sanitizar (índice)", com_indice))
+    print(linha("sanitizar (reindexa)", sem_indice))
+
+
+if __name__ == "__main__":
+    main()
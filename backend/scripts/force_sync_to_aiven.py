@@ -26,6 +26,18 @@ try:
 except ImportError:
     pass
 
+def _chave_conflito(cur, table):
+    """Colunas da PK no destino, para o ON CONFLICT: (id) numa tabela comum,
+    (id, chave de partição) numa particionada (flask particionar-tabelas)."""
+    cur.execute(
+        "SELECT a.attname FROM pg_index i JOIN pg_attribute a "
+        "ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+        "WHERE i.indrelid = to_regclass(%s) AND i.indisprimary",
+        (f'public."{table}"',),
+    )
+    return [r[0] for r in cur.fetchall()] or ["id"]
+
+
 def _parse_url(url, force_no_ssl=False):
     """Parse URL postgres para dict de parâmetros psycopg2."""
     if not url: return {}
@@ -155,15 +167,18 @@ def force_sync(app=None, silent=False):
             
             has_id = "id" in valid_cols
             if has_id:
-                upd = ", ".join([f'"{c}"=EXCLUDED."{c}"' for c in valid_cols if c != 'id'])
+                pk = _chave_conflito(acur, table)
+                aconn.commit()
+                alvo = ", ".join(f'"{c}"' for c in pk)
+                upd = ", ".join([f'"{c}"=EXCLUDED."{c}"' for c in valid_cols if c not in pk])
                 if upd:
                     # Proteção Sênior: Eventual Consistency (Evita Sobrescrever Dados Mais Novos da Nuvem)
                     if "updated_at" in valid_cols:
-                        upsert = f'ON CONFLICT (id) DO UPDATE SET {upd} WHERE "{table}".updated_at <= EXCLUDED.updated_at'
+                        upsert = f'ON CONFLICT ({alvo}) DO UPDATE SET {upd} WHERE "{table}".updated_at <= EXCLUDED.updated_at'
                     else:
-                        upsert = f"ON CONFLICT (id) DO UPDATE SET {upd}"
+                        upsert = f"ON CONFLICT ({alvo}) DO UPDATE SET {upd}"
                 else:
-                    upsert = "ON CONFLICT (id) DO NOTHING"
+                    upsert = f"ON CONFLICT ({alvo}) DO NOTHING"
             else:
                 upsert = "ON CONFLICT DO NOTHING"
 
@@ -24,7 +24,7 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if BASE_DIR not in sys.path:
     sys.path.append(BASE_DIR)
 
-from scripts.force_sync_to_aiven import _parse_url
+from scripts.force_sync_to_aiven import _chave_conflito, _parse_url
 
 BATCH = 2000
 
@@ -143,11 +143,13 @@ def robust_sync(silent=False):
 
                 has_upd = "updated_at" in cols
                 collist = ", ".join(f'"{c}"' for c in cols)
-                upd = ", ".join(f'"{c}"=EXCLUDED."{c}"' for c in cols if c != "id")
+                pk = _chave_conflito(ac, table)  # (id, chave) se a tabela for particionada
+                alvo = ", ".join(f'"{c}"' for c in pk)
+                upd = ", ".join(f'"{c}"=EXCLUDED."{c}"' for c in cols if c not in pk)
                 conflict = (
-                    f'ON CONFLICT (id) DO UPDATE SET {upd} '
+                    f'ON CONFLICT ({alvo}) DO UPDATE SET {upd} '
                     + (f'WHERE "{table}".updated_at <= EXCLUDED.updated_at' if has_upd else "")
-                ) if upd else "ON CONFLICT (id) DO NOTHING"
+                ) if upd else f"ON CONFLICT ({alvo}) DO NOTHING"
                 sql_bulk = f'INSERT INTO "{table}" ({collist}) VALUES %s {conflict}'
                 placeholders = ", ".join(["%s"] * len(cols))
                 sql_single = f'INSERT INTO "{table}" ({collist}) VALUES ({placeholders}) {conflict}'
@@ -4,7 +4,8 @@ sync_sfa_to_aiven.py — Sincronização FOCADA da Força de Vendas (local -> Ai
 Diferente do force_sync_to_aiven (banco inteiro, lento), este sobe SOMENTE as
 tabelas do módulo SFA, na ordem correta de FK. As dependências (clientes,
 produtos, funcionarios) já vivem no Aiven, então isto roda em segundos e é
-idempotente (ON CONFLICT id DO UPDATE, respeitando updated_at quando existe).
+idempotente (ON CONFLICT na PK do destino DO UPDATE, respeitando updated_at quando
+existe).
 
 Uso:
     python -m scripts.sync_sfa_to_aiven            # todos os estabelecimentos
@@ -23,6 +24,11 @@ import psycopg2
 import psycopg2.extras
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from scripts.force_sync_to_aiven import _chave_conflito
+
 try:
     from dotenv import load_dotenv
     load_dotenv(os.path.join(BASE_DIR, ".env"))
@@ -106,13 +112,15 @@ def sync(estab_id=None):
             lcur.execute(f'SELECT {", ".join(chr(34)+c+chr(34) for c in cols)} FROM "{table}"{filtro}', params)
             rows = lcur.fetchall()
             cs = ", ".join(f'"{c}"' for c in cols)
-            upd = ", ".join(f'"{c}"=EXCLUDED."{c}"' for c in cols if c != "id")
+            pk = _chave_conflito(acur, table)
+            alvo = ", ".join(f'"{c}"' for c in pk)
+            upd = ", ".join(f'"{c}"=EXCLUDED."{c}"' for c in cols if c not in pk)
             if "updated_at" in cols and upd:
-                conflict = f'ON CONFLICT (id) DO UPDATE SET {upd} WHERE "{table}".updated_at <= EXCLUDED.updated_at'
+                conflict = f'ON CONFLICT ({alvo}) DO UPDATE SET {upd} WHERE "{table}".updated_at <= EXCLUDED.updated_at'
             elif upd:
-                conflict = f"ON CONFLICT (id) DO UPDATE SET {upd}"
+                conflict = f"ON CONFLICT ({alvo}) DO UPDATE SET {upd}"
             else:
-                conflict = "ON CONFLICT (id) DO NOTHING"
+                conflict = f"ON CONFLICT ({alvo}) DO NOTHING"
             data = []
             for r in rows:
                 vals = []
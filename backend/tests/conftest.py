@@ -2,7 +2,7 @@ import pytest
 import os
 import random
 import string
-from datetime import date
+from datetime import date, time
 from decimal import Decimal
 
 # Patch environment BEFORE anything else
@@ -93,3 +93,26 @@ def session(app):
 
         db.session.commit()
         yield db.session
+
+
+@pytest.fixture
+def loja_ponto(session):
+    """Loja com jornada configurada (entrada 8h, 480 min, tolerância 10) e o
+    admin como funcionário do ponto: (estab, funcionário, headers)."""
+    from flask import g, has_request_context
+    from flask_jwt_extended import create_access_token
+    import app.routes.ponto as ponto
+    from app.models import ConfiguracaoHorario
+
+    ponto._config_id_cache.clear()
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    func_ = session.query(Funcionario).filter_by(estabelecimento_id=estab.id).first()
+    func_.nivel_acesso = 1
+    session.add(ConfiguracaoHorario(estabelecimento_id=estab.id, exigir_foto=False, exigir_localizacao=False,
+                                    hora_entrada=time(8, 0), tolerancia_entrada=10, jornada_diaria_minutos=480))
+    session.commit()
+    headers = {"Authorization": "Bearer " + create_access_token(
+        identity=str(func_.id), additional_claims={"estabelecimento_id": estab.id, "role": "admin"})}
+    return estab, func_, headers
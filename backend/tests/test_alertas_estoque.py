@@ -0,0 +1,172 @@
+"""
+Motor de alertas de estoque: detecção set-based, persistência só das transições
+(novo → ativo → resolvido), notificação em lote por loja e /produtos/alertas
+lendo o estado persistido.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+from flask import g, has_request_context
+from flask_jwt_extended import create_access_token
+
+from app.models import db, AlertaEstoque, CategoriaProduto, Configuracao, Estabelecimento, Funcionario, Produto, ProdutoLote
+from app.services.estoque_alertas_service import EstoqueAlertasService
+
+
+@pytest.fixture
+def base_alertas(session):
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    admin = Funcionario.query.first()
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Mercearia")
+    session.add(cat)
+    session.flush()
+
+    def _produto(nome, qtd, minima):
+        p = Produto(
+            estabelecimento_id=estab.id, categoria_id=cat.id, nome=nome,
+            preco_custo=Decimal("2.00"), preco_venda=Decimal("4.00"),
+            quantidade=qtd, quantidade_minima=minima, ativo=True,
+        )
+        session.add(p)
+        return p
+
+    ruptura = _produto("Arroz 5kg", 0, 5)
+    iogurte = _produto("Iogurte", 50, 1)
+    ok = _produto("Feijão 1kg", 100, 5)
+    session.flush()
+
+    hoje = date.today()
+    lote_vencido = ProdutoLote(
+        estabelecimento_id=estab.id, produto_id=iogurte.id, numero_lote="L-VENC",
+        quantidade=Decimal("10"), quantidade_inicial=Decimal("10"),
+        data_validade=hoje - timedelta(days=2), preco_custo_unitario=Decimal("2.00"),
+    )
+    lote_critico = ProdutoLote(
+        estabelecimento_id=estab.id, produto_id=iogurte.id, numero_lote="L-CRIT",
+        quantidade=Decimal("20"), quantidade_inicial=Decimal("20"),
+        data_validade=hoje + timedelta(days=3), preco_custo_unitario=Decimal("2.00"),
+    )
+    lote_longe = ProdutoLote(
+        estabelecimento_id=estab.id, produto_id=ok.id, numero_lote="L-OK",
+        quantidade=Decimal("20"), quantidade_inicial=Decimal("20"),
+        data_validade=hoje + timedelta(days=200), preco_custo_unitario=Decimal("2.00"),
+    )
+    session.add_all([lote_vencido, lote_critico, lote_longe])
+    session.commit()
+    return {
+        "estab": estab, "admin": admin, "ruptura": ruptura, "ok": ok,
+        "lote_vencido": lote_vencido, "lote_critico": lote_critico,
+    }
+
+
+def _estados(estab_id):
+    return {a.chave: a.estado for a in AlertaEstoque.query.filter_by(estabelecimento_id=estab_id).all()}
+
+
+def test_sincronizar_grava_apenas_transicoes(session, base_alertas):
+    estab = base_alertas["estab"]
+    ruptura = base_alertas["ruptura"]
+
+    resumo = EstoqueAlertasService.sincronizar(estab.id)
+    assert resumo[estab.id]["novos"] == 3
+    estados = _estados(estab.id)
+    assert estados == {
+        f"estoque_baixo:{ruptura.id}:0": "novo",
+        f"lote_vencido:{base_alertas['lote_vencido'].produto_id}:{base_alertas['lote_vencido'].id}": "novo",
+        f"lote_vencendo_critico:{base_alertas['lote_critico'].produto_id}:{base_alertas['lote_critico'].id}": "novo",
+    }
+
+    # Condição persiste → ativo (sem duplicar linhas)
+    resumo = EstoqueAlertasService.sincronizar(estab.id)
+    assert resumo[estab.id] == {"novos": 0, "ativos": 3, "resolvidos": 0}
+    assert set(_estados(estab.id).values()) == {"ativo"}
+
+    # Reposição resolve a ruptura; nova ruptura reabre como novo
+    ruptura.quantidade = 30
+    session.commit()
+    EstoqueAlertasService.sincronizar(estab.id)
+    chave = f"estoque_baixo:{ruptura.id}:0"
+    alerta = AlertaEstoque.query.filter_by(estabelecimento_id=estab.id, chave=chave).one()
+    assert alerta.estado == "resolvido" and alerta.resolvido_em is not None
+
+    ruptura.quantidade = 0
+    session.commit()
+    EstoqueAlertasService.sincronizar(estab.id)
+    db.session.refresh(alerta)
+    assert alerta.estado == "novo" and alerta.resolvido_em is None
+    assert AlertaEstoque.query.filter_by(estabelecimento_id=estab.id).count() == 3
+
+
+def test_notificacao_em_lote_por_loja(session, base_alertas):
+    estab = base_alertas["estab"]
+    config = Configuracao.query.filter_by(estabelecimento_id=estab.id).first()
+    if config is None:
+        config = Configuracao(estabelecimento_id=estab.id)
+        session.add(config)
+    config.alertas_email = True
+    session.commit()
+
+    EstoqueAlertasService.sincronizar(estab.id)
+    # Envio falhou: o claim é desfeito e os alertas voltam para a próxima rodada
+    with patch("app.services.email_service.notificar_alertas_estoque", return_value=False):
+        assert EstoqueAlertasService.notificar_pendentes(estab.id) == {}
+    assert AlertaEstoque.query.filter(AlertaEstoque.estabelecimento_id == estab.id,
+                                      AlertaEstoque.notificado_em.isnot(None)).count() == 0
+
+    with patch("app.services.email_service.notificar_alertas_estoque", return_value=True) as envio:
+        assert EstoqueAlertasService.notificar_pendentes(estab.id) == {estab.id: 3}
+        assert envio.call_count == 1
+        _, alertas = envio.call_args.args
+        assert alertas[0]["nivel"] == "critico"
+
+        # Já notificados: a próxima rodada não reenvia
+        assert EstoqueAlertasService.notificar_pendentes(estab.id) == {}
+        assert envio.call_count == 1
+
+
+def test_rota_alertas_le_estado_persistido(client, base_alertas):
+    estab = base_alertas["estab"]
+    admin = base_alertas["admin"]
+    token = create_access_token(identity=str(admin.id), additional_claims={
+        "estabelecimento_id": estab.id, "role": "admin",
+    })
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # Sem passada do job, a leitura não sincroniza nem commita no GET
+    with patch.object(EstoqueAlertasService, "detectar") as detectar:
+        resp = client.get("/api/produtos/alertas", headers=headers)
+        assert resp.status_code == 200 and resp.get_json()["total"] == 0
+        assert detectar.call_count == 0
+
+    EstoqueAlertasService.sincronizar(estab.id)  # o que o job agendado faz
+    resp = client.get("/api/produtos/alertas", headers=headers)
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    body = resp.get_json()
+    assert body["total"] == 3
+    assert body["resumo"]["lote_vencido"] == 1
+    assert body["resumo"]["estoque_baixo"] == 1
+    assert body["alertas"][0]["nivel"] == "critico"
+    assert body["produtos_afetados_validade"] == 1
+
+    resp = client.get("/api/produtos/alertas?tipo=lote_vencido", headers=headers)
+    assert resp.get_json()["total"] == 1
+    assert resp.get_json()["dias_alerta"] == EstoqueAlertasService.DIAS_ALERTA_PADRAO
+
+    # Passada concorrente grava as mesmas chaves entre a leitura e a inserção: sem erro de unicidade
+    tabela = AlertaEstoque.__table__
+    gravadas = [dict(r) for r in db.session.execute(tabela.select()).mappings()]
+    db.session.execute(tabela.delete())
+    db.session.commit()
+    original = EstoqueAlertasService._inserir_novos
+
+    def _concorrente(t):
+        db.session.execute(t.insert(), gravadas)
+        return original(t)
+
+    with patch.object(EstoqueAlertasService, "_inserir_novos", staticmethod(_concorrente)):
+        EstoqueAlertasService.sincronizar(estab.id)
+    assert AlertaEstoque.query.filter_by(estabelecimento_id=estab.id).count() == 3
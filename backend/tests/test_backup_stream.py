@@ -0,0 +1,153 @@
+"""
+Backup/exportação em streaming: ZIP gerado em lotes (uma tabela por membro),
+cursor para backup incremental, retomada por `apos` e restauração com upsert
+em lotes, sempre restrita à loja do token.
+"""
+import csv
+import io
+import json
+import zipfile
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import select
+
+from app.models import db, CategoriaProduto, Estabelecimento, Funcionario, Produto
+from app.services import backup_stream
+
+
+def _nova_loja(session, sufixo):
+    estab = Estabelecimento(
+        nome_fantasia=f"Outra {sufixo}", razao_social=f"Outra {sufixo} LTDA", cnpj=f"9876543200{sufixo}",
+        email=f"outra{sufixo}@mercadinho.sys", telefone="92999999999", data_abertura=date(2024, 1, 1),
+        plano="PREMIUM", vencimento_plano=date(2030, 12, 31), cep="69000-000", logradouro="Rua B",
+        numero="2", bairro="Centro", cidade="Manaus", estado="AM", pais="Brasil",
+    )
+    session.add(estab)
+    session.flush()
+    return estab
+
+
+def _produtos(session, estab, quantos, prefixo="Produto"):
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome=f"Geral {prefixo}")
+    session.add(cat)
+    session.flush()
+    produtos = [Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome=f"{prefixo} {i}",
+                        preco_custo=Decimal("1.10"), preco_venda=Decimal("2.35"), quantidade=i)
+                for i in range(quantos)]
+    session.add_all(produtos)
+    session.commit()
+    return produtos
+
+
+@pytest.fixture
+def loja(session):
+    estab = session.query(Estabelecimento).first()
+    func = db.session.execute(select(Funcionario).filter_by(estabelecimento_id=estab.id)).scalars().first()
+    headers = {"Authorization": "Bearer " + create_access_token(
+        identity=str(func.id), additional_claims={"estabelecimento_id": estab.id, "role": "admin"})}
+    return estab, headers
+
+
+def _zip(dados):
+    return zipfile.ZipFile(io.BytesIO(dados))
+
+
+def test_exportacao_power_bi_sai_em_streaming_por_tabela(client, session, loja, monkeypatch):
+    estab, headers = loja
+    monkeypatch.setattr(backup_stream, "_LOTE", 7)
+    _produtos(session, estab, 25)
+    _produtos(session, _nova_loja(session, "01"), 3, prefixo="Alheio")
+
+    resp = client.get("/api/relatorios/backup/exportar", headers=headers)
+    assert resp.status_code == 200 and resp.is_streamed
+    assert resp.headers["Content-Type"] == "application/zip" and resp.headers["X-Backup-Cursor"]
+    blocos = list(resp.response)
+    assert len(blocos) > 4  # saiu em pedaços, não num buffer único
+
+    zf = _zip(b"".join(blocos))
+    assert {"manifesto.json", "dicionario_dados.json", "produtos.csv", "venda_itens.csv"} <= set(zf.namelist())
+    linhas = list(csv.DictReader(io.TextIOWrapper(zf.open("produtos.csv"), encoding="utf-8")))
+    assert len(linhas) == 25 and all(l["estabelecimento_id"] == str(estab.id) for l in linhas)
+    assert Decimal(linhas[0]["preco_venda"]) == Decimal("2.35")
+    assert json.loads(zf.read("contagens.json"))["produtos"] == 25
+
+    resp = client.get("/api/relatorios/backup/exportar?formato=xls", headers=headers)
+    assert resp.status_code == 400
+
+
+def test_incremental_e_retomada_pelo_cursor(client, session, loja):
+    estab, headers = loja
+    produtos = _produtos(session, estab, 10)
+    resp = client.get("/api/relatorios/backup/exportar?formato=ndjson", headers=headers)
+    cursor = resp.headers["X-Backup-Cursor"]
+    assert sum(1 for _ in _zip(resp.data).open("produtos.ndjson")) == 10
+
+    # Download interrompido depois do 4º produto: retoma dali, no mesmo cursor
+    resp = client.get(f"/api/relatorios/backup/exportar?formato=ndjson&cursor={cursor}"
+                      f"&apos=produtos:{produtos[3].id}", headers=headers)
+    zf = _zip(resp.data)
+    ids = [json.loads(l)["id"] for l in zf.open("produtos.ndjson")]
+    assert ids == [p.id for p in produtos[4:]]
+    assert json.loads(zf.read("manifesto.json"))["retomado_apos"] == f"produtos:{produtos[3].id}"
+    resp = client.get(f"/api/relatorios/backup/exportar?formato=ndjson&cursor={cursor}&apos=vendas:0",
+                      headers=headers)
+    assert "produtos.ndjson" not in _zip(resp.data).namelist()  # tabelas já recebidas ficam de fora
+
+    produtos[0].nome = "Produto renomeado"
+    session.commit()
+    _produtos(session, estab, 1, prefixo="Novo")
+    resp = client.get(f"/api/relatorios/backup/exportar?formato=ndjson&desde={cursor}", headers=headers)
+    manifesto = json.loads(_zip(resp.data).read("manifesto.json"))
+    nomes = [json.loads(l)["nome"] for l in _zip(resp.data).open("produtos.ndjson")]
+    assert manifesto["incremental"] and sorted(nomes) == ["Novo 0", "Produto renomeado"]
+
+    resp = client.get("/api/relatorios/backup/exportar?desde=lixo", headers=headers)
+    assert resp.status_code == 400
+
+
+def test_backup_em_disco_e_restauracao_em_lotes(app, client, session, loja, tmp_path):
+    estab, headers = loja
+    app.config["BACKUP_FOLDER"] = str(tmp_path)
+    try:
+        produtos = _produtos(session, estab, 12)
+        resp = client.post("/api/sync-hybrid/backup", json={}, headers=headers)
+        body = resp.get_json()
+        assert resp.status_code == 200, body
+        assert not list(tmp_path.glob("*.part"))
+
+        # Estrago depois do backup: um produto apagado, outro alterado
+        apagado_id = produtos[5].id
+        session.delete(produtos[5])
+        produtos[6].nome = "Alterado depois"
+        session.commit()
+
+        resp = client.post("/api/sync-hybrid/restore", json={"filename": body["filename"]}, headers=headers)
+        assert resp.status_code == 200, resp.get_json()
+        assert resp.get_json()["restored"]["produtos"] == {"inseridos": 1, "atualizados": 11, "conflitos": 0, "ignorados": 0}
+        session.expire_all()
+        assert db.session.get(Produto, apagado_id).nome == "Produto 5"
+        assert db.session.get(Produto, produtos[6].id).nome == "Produto 6"
+
+        # Incremental: só o que mudou desde o último backup
+        produtos[7].nome = "Mexido"
+        session.commit()
+        resp = client.post("/api/sync-hybrid/backup", json={"incremental": True}, headers=headers)
+        assert resp.get_json()["incremental"]
+        with zipfile.ZipFile(tmp_path / resp.get_json()["filename"]) as zf:
+            assert [json.loads(l)["nome"] for l in zf.open("produtos.ndjson")] == ["Mexido"]
+
+        # Linhas de outra loja no arquivo nunca entram nem sobrescrevem nada
+        alheio = _produtos(session, _nova_loja(session, "02"), 1, prefixo="Alheio")[0]
+        linhas = [{"id": alheio.id, "estabelecimento_id": estab.id, "nome": "Sequestro",
+                   "categoria_id": alheio.categoria_id, "preco_custo": "1", "preco_venda": "2"},
+                  {"id": produtos[0].id, "estabelecimento_id": alheio.estabelecimento_id, "nome": "Intruso"}]
+        resumo = backup_stream.restaurar_linhas("produtos", linhas, estab.id, lote=1)
+        db.session.commit()
+        assert resumo["conflitos"] == 1 and resumo["ignorados"] == 1
+        nome_alheio = db.session.execute(select(Produto.nome).where(Produto.id == alheio.id)).scalar()
+        assert nome_alheio == "Alheio 0"
+    finally:
+        app.config.pop("BACKUP_FOLDER", None)
@@ -0,0 +1,104 @@
+"""
+Banco de horas como razão só de inserção (banco_horas_service): lançamento por
+dia a cada batida/ajuste/justificativa, saldo corrido lido do último
+lançamento e conferidor que refaz o intervalo a partir das batidas.
+"""
+from datetime import date, time, timedelta
+
+import pytest
+
+from app.models import db, BancoHoras, BancoHorasLancamento, JustificativaPonto, RegistroPonto
+from app.services.banco_horas_service import BancoHorasService, minutos_esperados
+from app.services.ponto_diario_service import PontoDiarioService
+
+SEGUNDA = date(2026, 3, 2)
+
+
+def _batida(estab, func_, dia, hora, tipo):
+    db.session.add(RegistroPonto(estabelecimento_id=estab.id, funcionario_id=func_.id, data=dia, hora=hora,
+                                 tipo_registro=tipo, minutos_atraso=0, status="normal"))
+
+
+def _lancamentos(func_id):
+    return (BancoHorasLancamento.query.filter_by(funcionario_id=func_id)
+            .order_by(BancoHorasLancamento.sequencia).all())
+
+
+def test_batida_e_ajuste_lancam_delta_e_saldo_corrido(client, loja_ponto):
+    estab, func_, headers = loja_ponto
+    hoje = date.today()
+    esperado = minutos_esperados(hoje, 480)
+    for hora, tipo in (("08:00", "entrada"), ("18:00", "saida")):
+        r = client.post("/api/ponto/registrar", headers=headers, json={
+            "tipo_registro": tipo, "data_local": hoje.isoformat(), "hora_local": hora})
+        assert r.status_code == 201, r.get_json()
+    saida_id = r.get_json()["data"]["id"]
+
+    # Entrada sozinha não conta; a saída fecha o dia
+    primeiro = _lancamentos(func_.id)
+    assert [(l.valor_dia, l.saldo_minutos) for l in primeiro] == [(600 - esperado, 600 - esperado)]
+    instante = primeiro[0].criado_em
+
+    assert client.put(f"/api/ponto/{saida_id}", headers=headers, json={"hora": "16:00:00"}).status_code == 200
+    lancs = _lancamentos(func_.id)
+    assert [(l.sequencia, l.delta_minutos, l.saldo_minutos) for l in lancs] == [
+        (1, 600 - esperado, 600 - esperado), (2, -120, 480 - esperado)]
+    assert BancoHorasService.saldo(func_.id) == 480 - esperado
+    assert BancoHorasService.saldo(func_.id, em=instante) == 600 - esperado
+    assert BancoHorasService.saldo(func_.id, em=instante - timedelta(seconds=1)) == 0
+
+    mes = BancoHoras.query.filter_by(funcionario_id=func_.id, mes_referencia=hoje.strftime("%Y-%m")).one()
+    assert (mes.saldo_minutos, mes.horas_trabalhadas_minutos) == (480 - esperado, 480)
+
+    # Razão não aceita edição
+    lancs[0].delta_minutos = 0
+    with pytest.raises(ValueError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_justificativa_aprovada_abona_o_debito_do_dia(client, loja_ponto):
+    estab, func_, headers = loja_ponto
+    _batida(estab, func_, SEGUNDA, time(8, 0), "entrada")
+    _batida(estab, func_, SEGUNDA, time(15, 0), "saida")
+    PontoDiarioService.recalcular_dia(func_.id, estab.id, SEGUNDA)
+    just = JustificativaPonto(estabelecimento_id=estab.id, funcionario_id=func_.id, tipo="saida_antecipada",
+                              data=SEGUNDA, motivo="Consulta médica")
+    db.session.add(just)
+    db.session.commit()
+    assert BancoHorasService.saldo(func_.id) == -60
+
+    r = client.put(f"/api/rh/justificativas/{just.id}/responder", headers=headers, json={"acao": "aprovar"})
+    assert r.status_code == 200, r.get_json()
+    saldo = client.get("/api/rh/banco-horas/saldo", headers=headers).get_json()["data"]
+    assert (saldo["saldo_minutos"], saldo["sequencia"]) == (0, 2)
+
+    extrato = client.get("/api/rh/banco-horas/extrato", headers=headers).get_json()
+    assert [(l["origem"], l["delta_minutos"], l["referencia_id"]) for l in extrato["data"]] == [
+        ("justificativa", 60, just.id), ("ponto", -60, None)]
+    listagem = client.get("/api/rh/banco-horas", headers=headers, query_string={"mes_referencia": "2026-03"})
+    assert listagem.get_json()["data"][0]["saldo_minutos"] == 0
+
+
+def test_conferidor_refaz_o_intervalo_das_batidas(client, loja_ponto):
+    estab, func_, headers = loja_ponto
+    sabado = SEGUNDA + timedelta(days=5)
+    for dia, saida in ((SEGUNDA, time(17, 30)), (sabado, time(12, 0))):
+        _batida(estab, func_, dia, time(8, 0), "entrada")
+        _batida(estab, func_, dia, saida, "saida")
+    db.session.commit()  # histórico gravado por fora do fluxo: razão vazio
+    assert _lancamentos(func_.id) == []
+
+    res = BancoHorasService.verificar(estabelecimento_id=estab.id, data_inicio=SEGUNDA, data_fim=sabado)
+    assert [(d["data"], d["esperado"]) for d in res["divergencias"]] == [
+        (SEGUNDA.isoformat(), 90), (sabado.isoformat(), 240)]
+    assert res["corrigidos"] == 0 and _lancamentos(func_.id) == []
+
+    r = client.post("/api/rh/banco-horas/verificar", headers=headers, json={
+        "data_inicio": SEGUNDA.isoformat(), "data_fim": sabado.isoformat(), "corrigir": True})
+    assert r.status_code == 200 and r.get_json()["data"]["corrigidos"] == 2
+    assert {l.origem for l in _lancamentos(func_.id)} == {"reconciliacao"}
+    assert BancoHorasService.saldo(func_.id) == 330
+
+    res = BancoHorasService.verificar(estabelecimento_id=estab.id)
+    assert res["divergencias"] == [] and res["cadeias_quebradas"] == []
@@ -0,0 +1,107 @@
+"""
+Totais correntes do caixa: cada movimentação atualiza caixa_totais na mesma
+transação; resumo/fechamento leem dali; histórico paginado por cursor; a
+reconciliação confere os totais contra o livro movimentacoes_caixa.
+"""
+from decimal import Decimal
+
+import pytest
+from flask import g, has_request_context
+from flask_jwt_extended import create_access_token
+
+from app.models import db, CaixaTotal, Estabelecimento, Funcionario, MovimentacaoCaixa
+from app.services.caixa_service import CaixaService
+
+
+@pytest.fixture
+def caixa_aberto(session, client):
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    admin = Funcionario.query.first()
+    token = create_access_token(identity=str(admin.id), additional_claims={
+        "estabelecimento_id": estab.id, "role": "admin",
+    })
+    headers = {"Authorization": f"Bearer {token}"}
+
+    resp = client.post("/api/caixas/abrir", json={"saldo_inicial": 100}, headers=headers)
+    assert resp.status_code == 201, resp.get_data(as_text=True)
+    caixa_id = resp.get_json()["data"]["id"]
+
+    for i, (valor, forma) in enumerate([
+        ("10.50", "DINHEIRO"), ("20.00", "Cartão de Crédito"), ("5.25", "dinheiro"), ("7.00", "PIX"),
+    ]):
+        session.add(MovimentacaoCaixa(
+            estabelecimento_id=estab.id, caixa_id=caixa_id, tipo="venda",
+            valor=Decimal(valor), forma_pagamento=forma, descricao=f"Venda {i}",
+        ))
+    session.commit()
+    return {"estab": estab, "caixa_id": caixa_id, "headers": headers}
+
+
+def test_totais_atualizados_a_cada_movimentacao(client, caixa_aberto):
+    headers = caixa_aberto["headers"]
+    resp = client.post("/api/caixas/movimentacao", json={"tipo": "suprimento", "valor": 30}, headers=headers)
+    assert resp.status_code == 201, resp.get_data(as_text=True)
+
+    totais = {
+        (t.tipo, t.forma_pagamento): (t.quantidade, float(t.total))
+        for t in CaixaTotal.query.filter_by(caixa_id=caixa_aberto["caixa_id"]).all()
+    }
+    assert totais[("venda", "dinheiro")] == (2, 15.75)
+    assert totais[("venda", "cartao_credito")] == (1, 20.0)
+    assert totais[("suprimento", "dinheiro")] == (1, 30.0)
+    assert totais[("abertura", "dinheiro")] == (1, 100.0)
+
+    resp = client.get("/api/caixas/atual/resumo", headers=headers)
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    resumo = resp.get_json()["data"]
+    assert resumo["total_vendas"] == 42.75
+    assert resumo["total_suprimentos"] == 30.0
+    assert resumo["saldo_esperado_gaveta"] == 145.75
+    assert resumo["por_forma_pagamento"]["pix"] == {"quantidade": 1, "total": 7.0}
+
+    resp = client.post("/api/caixas/fechar", json={"valor_informado": 145.75}, headers=headers)
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    assert resp.get_json()["resumo_fechamento"]["quebra_gaveta"] == 0.0
+
+
+def test_historico_paginado_por_cursor(client, caixa_aberto):
+    headers = caixa_aberto["headers"]
+    resp = client.get("/api/caixas/atual/movimentacoes?limite=3", headers=headers)
+    body = resp.get_json()
+    assert len(body["data"]) == 3
+    assert body["paginacao"]["tem_proxima"] is True
+
+    cursor = body["paginacao"]["proximo_cursor"]
+    resp = client.get(f"/api/caixas/atual/movimentacoes?limite=3&antes_de={cursor}", headers=headers)
+    body = resp.get_json()
+    assert len(body["data"]) == 2  # abertura + 4 vendas = 5
+    assert body["paginacao"]["tem_proxima"] is False
+
+
+def test_reconciliacao_detecta_e_corrige_divergencia(client, caixa_aberto):
+    caixa_id = caixa_aberto["caixa_id"]
+    assert CaixaService.reconciliar(caixa_id)["consistente"] is True
+
+    # Insert fora do ORM (ex.: sincronização em massa) não passa pelos listeners.
+    db.session.execute(MovimentacaoCaixa.__table__.insert().values(
+        estabelecimento_id=caixa_aberto["estab"].id, caixa_id=caixa_id, tipo="sangria",
+        valor=Decimal("12.00"), forma_pagamento="DINHEIRO", descricao="Sangria externa",
+    ))
+    db.session.commit()
+
+    resp = client.get("/api/caixas/atual/reconciliacao", headers=caixa_aberto["headers"])
+    data = resp.get_json()["data"]
+    assert data["consistente"] is False
+    assert data["divergencias"][0]["tipo"] == "sangria"
+
+    # GET é só leitura, mesmo pedindo correção
+    resp = client.get("/api/caixas/atual/reconciliacao?corrigir=true", headers=caixa_aberto["headers"])
+    assert resp.get_json()["data"]["corrigido"] is False
+    assert CaixaService.reconciliar(caixa_id)["consistente"] is False
+
+    resp = client.post("/api/caixas/atual/reconciliacao", headers=caixa_aberto["headers"])
+    assert resp.get_json()["data"]["corrigido"] is True
+    assert CaixaService.reconciliar(caixa_id)["consistente"] is True
+    assert CaixaService.totais(caixa_id)["total_sangrias"] == 12.0
@@ -0,0 +1,279 @@
+"""
+Cancelamento de venda (VendaService.cancelar): itens somados por produto,
+uma trava ordenada nos produtos (a mesma do checkout, travar_produtos),
+estoque/lotes/movimentações em lote e estorno de pagamentos, fiado e métricas
+do cliente sem uma consulta por linha. O último teste cancela e vende os
+mesmos SKUs em paralelo.
+"""
+import threading
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql
+
+from app.models import (
+    db, Caixa, CategoriaProduto, Cliente, Configuracao, ContaReceber, Estabelecimento, Funcionario,
+    MovimentacaoEstoque, Pagamento, Produto, ProdutoLote, Venda, VendaItem,
+)
+
+SENHA = "industrial-secret"
+
+
+def _catalogo(estab, admin):
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Atacado")
+    db.session.add(cat)
+    db.session.flush()
+    produtos = [Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome=nome, preco_custo=Decimal("2"),
+                        preco_venda=Decimal("5"), quantidade=Decimal("500"), quantidade_vendida=Decimal("0"),
+                        total_vendido=Decimal("0"))
+                for nome in ("Arroz 5kg", "Feijão 1kg", "Óleo 900ml")]
+    db.session.add_all(produtos)
+    db.session.add(Caixa(estabelecimento_id=estab.id, funcionario_id=admin.id, numero_caixa="PDV-01",
+                         saldo_inicial=Decimal("100"), saldo_atual=Decimal("100"), status="aberto",
+                         data_abertura=datetime.now(timezone.utc)))
+    admin.nivel_acesso = 1
+    db.session.commit()
+    return produtos
+
+
+def _headers(estab, admin):
+    return {"Authorization": "Bearer " + create_access_token(
+        identity=str(admin.id), additional_claims={"estabelecimento_id": estab.id, "role": "admin"})}
+
+
+@pytest.fixture
+def loja(session):
+    from flask import g, has_request_context
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    admin = session.query(Funcionario).filter_by(estabelecimento_id=estab.id).first()
+    produtos = _catalogo(estab, admin)
+    return estab, admin, produtos, _headers(estab, admin)
+
+
+def _cancelar(client, headers, venda_id):
+    return client.post(f"/api/vendas/{venda_id}/cancelar", headers=headers,
+                       json={"motivo": "Cliente desistiu", "senha_admin": SENHA})
+
+
+def test_cancelamento_em_lote_de_venda_atacado(client, loja):
+    estab, admin, (arroz, feijao, oleo), headers = loja
+    cliente = Cliente(estabelecimento_id=estab.id, nome="Mercearia do Zé", cpf="52998224725", celular="92988887777",
+                      total_compras=3, valor_total_gasto=Decimal("1000"), saldo_devedor=Decimal("400"),
+                      cep="69000-000", logradouro="Rua B", numero="2", bairro="Centro", cidade="Manaus", estado="AM")
+    lote = ProdutoLote(estabelecimento_id=estab.id, produto_id=arroz.id, numero_lote="L-ARROZ-1", quantidade=80,
+                       quantidade_inicial=100, data_validade=date(2027, 1, 1), preco_custo_unitario=2)
+    db.session.add_all([cliente, lote])
+    db.session.flush()
+
+    # 60 itens, SKUs repetidos: 20 × (arroz 2, feijão 1, óleo 3)
+    agora = datetime.now()
+    venda = Venda(estabelecimento_id=estab.id, funcionario_id=admin.id, cliente_id=cliente.id, codigo="ATAC-1",
+                  subtotal=600, total=600, valor_recebido=600, status="finalizada", data_venda=agora)
+    for _ in range(20):
+        for produto, qtd in ((arroz, 2), (feijao, 1), (oleo, 3)):
+            venda.itens.append(VendaItem(estabelecimento_id=estab.id, produto_id=produto.id, produto_nome=produto.nome,
+                                         quantidade=qtd, preco_unitario=5, total_item=5 * qtd, created_at=agora))
+    for produto, qtd in ((arroz, 40), (feijao, 20), (oleo, 60)):
+        produto.quantidade -= qtd
+        produto.quantidade_vendida += qtd
+        produto.total_vendido += 5 * qtd
+    db.session.add(venda)
+    db.session.flush()
+    db.session.add_all([
+        Pagamento(estabelecimento_id=estab.id, venda_id=venda.id, forma_pagamento="dinheiro", valor=200,
+                  status="aprovado", data_pagamento=agora),
+        Pagamento(estabelecimento_id=estab.id, venda_id=venda.id, forma_pagamento="fiado", valor=400,
+                  status="aprovado", data_pagamento=agora),
+        ContaReceber(estabelecimento_id=estab.id, cliente_id=cliente.id, venda_id=venda.id, numero_documento="DUP-1",
+                     valor_original=400, valor_atual=400, data_emissao=agora.date(), data_vencimento=agora.date()),
+        MovimentacaoEstoque(estabelecimento_id=estab.id, produto_id=arroz.id, lote_id=lote.id, venda_id=venda.id,
+                            tipo="saida", quantidade=40, quantidade_anterior=500, quantidade_atual=460,
+                            motivo="Venda ATAC-1", created_at=agora),
+    ])
+    db.session.commit()
+
+    consultas = []
+
+    def _anotar(conn, cursor, statement, parameters, context, executemany):
+        consultas.append(statement)
+
+    def _travas(orm_execute_state):
+        if orm_execute_state.is_select and orm_execute_state.statement._for_update_arg is not None:
+            travas.append(str(orm_execute_state.statement.compile(dialect=postgresql.dialect())))
+
+    atualizados = []
+
+    def _orm(mapper, connection, target):  # onde a auditoria forense e a sincronia se penduram
+        atualizados.append(target.__tablename__)
+
+    travas = []
+    event.listen(db.engine, "before_cursor_execute", _anotar)
+    event.listen(db.session, "do_orm_execute", _travas)
+    for modelo in (ProdutoLote, Pagamento, Cliente):
+        event.listen(modelo, "after_update", _orm)
+    try:
+        r = _cancelar(client, headers, venda.id)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _anotar)
+        event.remove(db.session, "do_orm_execute", _travas)
+        for modelo in (ProdutoLote, Pagamento, Cliente):
+            event.remove(modelo, "after_update", _orm)
+    corpo = r.get_json()
+    assert r.status_code == 200, corpo
+    assert corpo["revertido"] == {"produtos": 3, "quantidade_devolvida": 120.0, "lotes": 1,
+                                  "pagamentos_estornados": 2, "contas_canceladas": 1}
+
+    # Uma leitura de produtos, ordenada e com FOR UPDATE: venda, produtos, lotes e cliente, nessa ordem
+    leituras = [s for s in consultas if s.lstrip().upper().startswith("SELECT") and "FROM produtos" in s]
+    assert len(leituras) == 1
+    assert [t.split("FROM ")[1].split()[0] for t in travas] == ["vendas", "produtos", "produto_lotes", "clientes"]
+    assert travas[1].endswith("ORDER BY produtos.id FOR UPDATE")
+    assert sorted(atualizados) == ["clientes", "pagamentos", "pagamentos", "produto_lotes"]
+
+    for produto, estoque in ((arroz, 500), (feijao, 500), (oleo, 500)):
+        db.session.refresh(produto)
+        assert (float(produto.quantidade), float(produto.quantidade_vendida), float(produto.total_vendido)) == \
+            (estoque, 0.0, 0.0)
+    db.session.refresh(lote)
+    assert float(lote.quantidade) == 120
+    entradas = MovimentacaoEstoque.query.filter_by(venda_id=venda.id, tipo="entrada").all()
+    assert sorted((m.produto_id, float(m.quantidade), m.lote_id) for m in entradas) == [
+        (arroz.id, 40.0, lote.id), (feijao.id, 20.0, None), (oleo.id, 60.0, None)]
+    assert {p.status for p in Pagamento.query.filter_by(venda_id=venda.id)} == {"estornado"}
+    assert ContaReceber.query.filter_by(venda_id=venda.id).one().status == "cancelado"
+    db.session.refresh(cliente)
+    assert (cliente.total_compras, float(cliente.valor_total_gasto), float(cliente.saldo_devedor)) == (2, 400.0, 0.0)
+
+    r = _cancelar(client, headers, venda.id)
+    assert r.status_code == 400 and "já está cancelada" in r.get_json()["error"]
+
+
+def test_checkout_trava_os_produtos_na_ordem_do_cancelamento(client, loja):
+    estab, admin, (arroz, feijao, oleo), headers = loja
+    travas = []
+
+    def _travas(orm_execute_state):
+        if orm_execute_state.is_select and orm_execute_state.statement._for_update_arg is not None:
+            travas.append(str(orm_execute_state.statement.compile(dialect=postgresql.dialect())))
+
+    event.listen(db.session, "do_orm_execute", _travas)
+    try:
+        r = client.post("/api/pdv/finalizar", headers=headers, json={
+            "items": [{"id": oleo.id, "quantity": 1, "price": 5}, {"id": arroz.id, "quantity": 2, "price": 5},
+                      {"id": oleo.id, "quantity": 1, "price": 5}],
+            "subtotal": 20, "total": 20, "pagamentos": [{"forma": "dinheiro", "valor": 20}]})
+    finally:
+        event.remove(db.session, "do_orm_execute", _travas)
+    assert r.status_code == 201, r.get_json()
+    assert len(travas) == 1 and travas[0].endswith("ORDER BY produtos.id FOR UPDATE")
+    db.session.refresh(oleo)
+    assert float(oleo.quantidade) == 498
+
+    # Id de produto não numérico é erro do cliente (400), nos dois checkouts
+    for url, pagamentos in (("/api/pdv/finalizar", [{"forma": "dinheiro", "valor": 5}]),
+                            ("/api/vendas/", [{"forma_pagamento": "dinheiro", "valor": 5}])):
+        r = client.post(url, headers=headers, json={
+            "items": [{"id": "abc", "quantity": 1, "price": 5}], "subtotal": 5, "total": 5, "pagamentos": pagamentos})
+        assert r.status_code == 400 and "abc" in r.get_json()["error"]
+
+
+@pytest.fixture
+def banco_em_arquivo(app, tmp_path, monkeypatch):
+    """SQLite em arquivo com BEGIN IMMEDIATE: várias conexões de verdade, com
+    as escritas serializadas (o SQLite não tem trava de linha; no Postgres o
+    FOR UPDATE ordenado é que faz esse papel)."""
+    from app import cache
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'loja.db'}",
+                           connect_args={"timeout": 30, "check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _sem_begin_implicito(dbapi_conn, _):
+        dbapi_conn.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    db.session.remove()
+    cache.clear()
+    monkeypatch.setitem(db._app_engines[app], None, engine)
+    db.metadata.create_all(engine)
+
+    estab = Estabelecimento(nome_fantasia="Atacarejo", razao_social="Atacarejo LTDA", cnpj="12345678000199",
+                            email="loja@atacarejo.com", telefone="92999999999", data_abertura=date(2024, 1, 1),
+                            plano="PREMIUM", vencimento_plano=date(2030, 12, 31), cep="69000-000",
+                            logradouro="Rua Industrial", numero="101", bairro="Distrito", cidade="Manaus",
+                            estado="AM", pais="Brasil")
+    db.session.add(estab)
+    db.session.flush()
+    admin = Funcionario(estabelecimento_id=estab.id, nome="Gerente", cpf="11122233344", username="gerente_atac",
+                        role="admin", ativo=True, data_nascimento=date(1990, 1, 1), celular="92999999999",
+                        email="gerente@atacarejo.com", cargo="Gerente", data_admissao=date(2024, 1, 1),
+                        salario_base=Decimal("5000.00"))
+    admin.set_password(SENHA)
+    db.session.add_all([admin, Configuracao(estabelecimento_id=estab.id)])
+    db.session.flush()
+    produtos = _catalogo(estab, admin)
+    yield estab, admin, produtos, _headers(estab, admin)
+    db.session.remove()
+    cache.clear()
+    engine.dispose()
+
+
+def test_cancelar_e_vender_os_mesmos_skus_em_paralelo(app, banco_em_arquivo):
+    estab, admin, produtos, headers = banco_em_arquivo
+    ids = [p.id for p in produtos]
+    client = app.test_client()
+
+    def _venda(ordem):
+        itens = [{"id": pid, "quantity": 2, "price": 5} for pid in (ids if ordem else reversed(ids))]
+        return client.post("/api/pdv/finalizar", headers=headers, json={
+            "items": itens, "subtotal": 30, "total": 30, "pagamentos": [{"forma": "dinheiro", "valor": 30}]})
+
+    anteriores = [_venda(i % 2 == 0) for i in range(4)]
+    assert {r.status_code for r in anteriores} == {201}
+    a_cancelar = [r.get_json()["venda"]["id"] for r in anteriores]
+    db.session.remove()  # as requisições acima usaram a sessão deste contexto; solta a transação
+
+    largada = threading.Barrier(8)
+    respostas, erros = [], []
+
+    def _rodar(tarefa):
+        try:
+            with app.app_context():
+                largada.wait(timeout=30)
+                respostas.append(tarefa(app.test_client()))
+        except Exception as e:  # pragma: no cover - falha aparece no assert
+            erros.append(e)
+
+    tarefas = [lambda c, v=v: c.post(f"/api/vendas/{v}/cancelar", headers=headers,
+                                      json={"motivo": "Estorno", "senha_admin": SENHA})
+               for v in a_cancelar]
+    tarefas += [lambda c, i=i: c.post("/api/pdv/finalizar", headers=headers, json={
+        "items": [{"id": pid, "quantity": 3, "price": 5} for pid in (ids if i % 2 else reversed(ids))],
+        "subtotal": 45, "total": 45, "pagamentos": [{"forma": "dinheiro", "valor": 45}]}) for i in range(4)]
+    threads = [threading.Thread(target=_rodar, args=(t,)) for t in tarefas]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=120)
+
+    assert not erros
+    assert sorted(r.status_code for r in respostas) == [200] * 4 + [201] * 4, [r.get_json() for r in respostas]
+
+    db.session.remove()
+    assert Venda.query.filter_by(status="cancelada").count() == 4
+    for pid in ids:
+        # 500 - 4×2 vendidos + 4×2 devolvidos - 4×3 vendidos em paralelo
+        assert float(db.session.get(Produto, pid).quantidade) == 488
+        # Cada movimentação parte do saldo deixado pela anterior: nenhuma leitura de estoque antiga
+        movs = MovimentacaoEstoque.query.filter_by(produto_id=pid).order_by(MovimentacaoEstoque.id).all()
+        assert len(movs) == 12
+        assert all(float(a.quantidade_atual) == float(b.quantidade_anterior) for a, b in zip(movs, movs[1:]))
+        assert float(movs[-1].quantidade_atual) == 488
@@ -0,0 +1,124 @@
+"""
+Carrinho do PDV em estado quente (carrinho_service): lote de bipes numa
+chamada, versão otimista entre terminais, checkpoint em Venda/VendaItem e
+finalização a partir do carrinho do servidor.
+"""
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+import app.services.carrinho_service as carrinho_service
+from app.models import (
+    db, Caixa, CarrinhoPdv, CategoriaProduto, Estabelecimento, Funcionario, Produto, Venda, VendaItem,
+)
+
+
+@pytest.fixture
+def loja(session):
+    from flask import g, has_request_context
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    admin = session.query(Funcionario).filter_by(estabelecimento_id=estab.id).first()
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Mercearia")
+    session.add(cat)
+    session.flush()
+    produtos = [Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome=nome, preco_custo=Decimal("1"),
+                        preco_venda=Decimal(preco), quantidade=qtd)
+                for nome, preco, qtd in (("Arroz 1kg", "6.50", 10), ("Feijão 1kg", "8.00", 3))]
+    session.add_all(produtos)
+    session.add(Caixa(estabelecimento_id=estab.id, funcionario_id=admin.id, numero_caixa="PDV-01",
+                      saldo_inicial=Decimal("100"), saldo_atual=Decimal("100"), status="aberto",
+                      data_abertura=datetime.now(timezone.utc)))
+    session.commit()
+    headers = {"Authorization": "Bearer " + create_access_token(
+        identity=str(admin.id), additional_claims={"estabelecimento_id": estab.id, "role": "admin"})}
+    return estab, admin, produtos, headers
+
+
+def _abrir(client, admin, headers):
+    r = client.post("/api/vendas/pdv/ativo", headers=headers, json={"funcionario_id": admin.id})
+    assert r.status_code == 201, r.get_json()
+    return r.get_json()["venda_id"]
+
+
+def test_lote_de_bipes_sem_gravar_venda_item(client, loja):
+    estab, admin, (arroz, feijao), headers = loja
+    venda_id = _abrir(client, admin, headers)
+
+    r = client.post(f"/api/vendas/pdv/{venda_id}/adicionar-item", headers=headers, json={
+        "itens": [{"produto_id": arroz.id}, {"produto_id": arroz.id}, {"produto_id": feijao.id, "quantidade": 2}]})
+    corpo = r.get_json()
+    assert r.status_code == 200, corpo
+    assert (corpo["versao"], corpo["total"], corpo["quantidade_itens"]) == (2, 29.0, 4)
+    assert VendaItem.query.filter_by(venda_id=venda_id).count() == 0  # só o estado quente mudou
+
+    r = client.put(f"/api/vendas/pdv/{venda_id}/atualizar-quantidade", headers=headers,
+                   json={"produto_id": feijao.id, "quantidade": 4})
+    assert r.status_code == 400 and "Estoque insuficiente" in r.get_json()["error"]
+    # remover-item é pelo id do VendaItem: um id de produto não é aceito no lugar
+    r = client.delete(f"/api/vendas/pdv/{venda_id}/remover-item/{feijao.id}", headers=headers)
+    assert r.status_code == 404
+    r = client.put(f"/api/vendas/pdv/{venda_id}/atualizar-quantidade", headers=headers,
+                   json={"item_id": "abc", "quantidade": 1})
+    assert r.status_code == 400
+    r = client.delete(f"/api/vendas/pdv/{venda_id}/remover-produto/{feijao.id}", headers=headers)
+    assert r.status_code == 200 and r.get_json()["total"] == 13.0
+
+    ativos = client.get("/api/vendas/pdv/carrinhos-ativos", headers=headers).get_json()["carrinhos_ativos"]
+    assert [(c["venda_id"], c["versao"], c["total"]) for c in ativos] == [(venda_id, 3, 13.0)]
+
+
+def test_versao_desatualizada_recebe_conflito(client, loja, monkeypatch):
+    estab, admin, (arroz, feijao), headers = loja
+    venda_id = _abrir(client, admin, headers)
+    url = f"/api/vendas/pdv/{venda_id}/operacoes"
+    assert client.post(url, headers=headers, json={
+        "versao": 1, "operacoes": [{"produto_id": arroz.id}]}).status_code == 200
+
+    # Outro terminal ainda com a versão 1
+    r = client.post(url, headers=headers, json={"versao": 1, "operacoes": [{"produto_id": feijao.id}]})
+    assert r.status_code == 409
+    assert r.get_json()["carrinho"]["versao"] == 2
+
+    # Escrita concorrente entre a leitura e o UPDATE: sem versão, o lote é reaplicado
+    carrinho = CarrinhoPdv.query.filter_by(venda_id=venda_id).one()
+    tabela = CarrinhoPdv.__table__
+    original = carrinho_service.CarrinhoService._novos_itens
+
+    def _concorrente(carrinho_, operacoes):
+        itens = original(carrinho_, operacoes)
+        if carrinho_.versao == 2:
+            db.session.execute(tabela.update().where(tabela.c.id == carrinho_.id).values(versao=3))
+        return itens
+
+    monkeypatch.setattr(carrinho_service.CarrinhoService, "_novos_itens", staticmethod(_concorrente))
+    carrinho_service.CarrinhoService.aplicar(carrinho, [{"produto_id": feijao.id}])
+    assert carrinho.versao == 4 and float(carrinho.total) == 14.5
+
+
+def test_checkpoint_recuperacao_e_finalizacao(client, loja, monkeypatch):
+    estab, admin, (arroz, feijao), headers = loja
+    monkeypatch.setattr(carrinho_service, "CHECKPOINT_OPERACOES", 2)
+    venda_id = _abrir(client, admin, headers)
+    for produto in (arroz, feijao):
+        client.post(f"/api/vendas/pdv/{venda_id}/adicionar-item", headers=headers, json={"produto_id": produto.id})
+    assert {i.produto_id for i in VendaItem.query.filter_by(venda_id=venda_id)} == {arroz.id, feijao.id}
+
+    # Terminal reiniciado sem a linha quente: retoma do checkpoint
+    db.session.execute(CarrinhoPdv.__table__.delete())
+    db.session.commit()
+    carrinho = client.get(f"/api/vendas/pdv/{venda_id}/carrinho", headers=headers).get_json()["carrinho"]
+    assert (carrinho["versao"], carrinho["total"]) == (1, 14.5)
+
+    r = client.post("/api/pdv/finalizar", headers=headers, json={
+        "carrinho_id": venda_id, "versao": 1, "pagamentos": [{"forma": "dinheiro", "valor": 20}]})
+    assert r.status_code == 201, r.get_json()
+    final = db.session.get(Venda, r.get_json()["venda"]["id"])
+    assert (final.status, float(final.total), len(final.itens)) == ("finalizada", 14.5, 2)
+    assert float(db.session.get(Produto, arroz.id).quantidade) == 9
+    assert db.session.get(Venda, venda_id) is None
+    assert CarrinhoPdv.query.filter_by(venda_final_id=final.id).one().status == "finalizado"
+    assert client.get("/api/vendas/pdv/carrinhos-ativos", headers=headers).get_json()["carrinhos_ativos"] == []
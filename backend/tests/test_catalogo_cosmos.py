@@ -0,0 +1,145 @@
+"""
+Catálogo mestre contra um Cosmos falso local: cache de EAN (inclusive
+negativo), coleta concorrente com token bucket e retomada por checkpoint
+depois de 429.
+"""
+import json
+import time
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import func, select
+
+from app.models import db, CatalogoMestre, CategoriaProduto, Estabelecimento, Produto
+from app.services import catalogo_mestre_service as catalogo
+from app.services.cosmos_fake import FakeCosmos
+from app.services.cosmos_harvester import BaldeDeFichas, ColetaCosmos, candidatos_dos_tenants
+
+COCA = "7894900011517"
+GUARANA = "7891991000833"
+INEXISTENTE = "7890000000001"
+
+
+def _produto_cosmos(nome):
+    return {"description": nome, "brand": {"name": "Marca"}, "ncm": {"code": "22021000"},
+            "gpc": {"description": "Refrigerantes"}, "avg_price": 8.5, "thumbnail": "http://img/x.png"}
+
+
+def _eans(n, base=7890000100000):
+    return [str(base + i) for i in range(n)]
+
+
+@pytest.fixture
+def cosmos(app):
+    fakes = []
+
+    def _iniciar(produtos, **kwargs):
+        fake = FakeCosmos(produtos, **kwargs).iniciar()
+        fakes.append(fake)
+        app.config["COSMOS_URL"] = fake.url
+        return fake
+    yield _iniciar
+    app.config.pop("COSMOS_URL", None)
+    for fake in fakes:
+        fake.parar()
+
+
+@pytest.fixture
+def headers(session):
+    estab = session.query(Estabelecimento).first()
+    token = create_access_token(identity="1", additional_claims={"estabelecimento_id": estab.id})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _total_catalogo():
+    return db.session.execute(select(func.count()).select_from(CatalogoMestre)).scalar()
+
+
+def test_lookup_usa_cache_inclusive_negativo(client, session, headers, cosmos):
+    fake = cosmos({COCA: _produto_cosmos("COCA-COLA 2L")})
+
+    r = client.get(f"/api/produtos/catalogo/lookup/{COCA}", headers=headers)
+    assert r.status_code == 200 and r.get_json()["source"] == "cosmos"
+    r = client.get(f"/api/produtos/catalogo/lookup/{COCA}", headers=headers)
+    assert r.status_code == 200 and r.get_json()["source"] == "catalogo"
+    assert r.get_json()["data"]["nome"] == "COCA-COLA 2L"
+    r = client.get(f"/api/produtos/cosmos/{COCA}", headers=headers)  # proxy devolve o payload guardado
+    assert r.status_code == 200 and r.get_json()["description"] == "COCA-COLA 2L"
+
+    for _ in range(3):
+        r = client.get(f"/api/produtos/catalogo/lookup/{INEXISTENTE}", headers=headers)
+        assert r.status_code == 404 and r.get_json()["code"] == "nao_encontrado"
+    assert len(fake.requisicoes) == 2  # 1 hit + 1 negativo; o resto saiu do cache
+    assert db.session.execute(select(CatalogoMestre).filter_by(ean=INEXISTENTE)).scalar() is None
+
+    # Lote: cache + um SELECT ... IN para o que faltar
+    db.session.add(CatalogoMestre(ean=GUARANA, nome="GUARANÁ 2L", status="encontrado"))
+    db.session.commit()
+    entradas = catalogo.buscar_eans([COCA, GUARANA, INEXISTENTE, "7890000000099"])
+    assert {e: v["status"] for e, v in entradas.items()} == {
+        COCA: "encontrado", GUARANA: "encontrado", INEXISTENTE: catalogo.AUSENTE}
+    assert catalogo.eans_conhecidos([COCA, GUARANA, INEXISTENTE]) == {COCA, GUARANA}
+
+
+def test_coleta_concorrente_cresce_catalogo_e_nao_reconsulta(app, session, cosmos):
+    eans = _eans(12)
+    fake = cosmos({e: _produto_cosmos(f"Produto {e}") for e in eans[:8]}, atraso=0.05)
+    estab = session.query(Estabelecimento).first()
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Bebidas")
+    db.session.add(cat)
+    db.session.flush()
+    for e in eans:
+        db.session.add(Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome=f"P {e}", codigo_barras=e,
+                               preco_custo=1, preco_venda=2, quantidade=1))
+    db.session.commit()
+
+    candidatos = candidatos_dos_tenants(limite=100)
+    assert sorted(candidatos) == eans
+    resumo = ColetaCosmos(limite=50, concorrencia=4, taxa_por_seg=500, rajada=4, lote_commit=5).executar(candidatos)
+    assert resumo == {"chamadas": 12, "encontrados": 8, "nao_encontrados": 4, "adiados": 0,
+                      "interrompido": None, "pendentes": 0}
+    assert 1 < fake.pico_concorrencia <= 4
+    assert _total_catalogo() == 12
+    assert catalogo.buscar_ean(eans[0])["nome"] == f"Produto {eans[0]}"
+
+    # Segunda coleta: nada novo para consultar
+    assert candidatos_dos_tenants(limite=100) == []
+    assert ColetaCosmos(limite=50).executar(eans)["chamadas"] == 0
+    assert len(fake.requisicoes) == 12
+
+    # Token bucket: rajada de 2 e depois 20/s → 6 fichas levam ~0,2 s
+    balde = BaldeDeFichas(taxa_por_seg=20, capacidade=2)
+    inicio = time.monotonic()
+    for _ in range(6):
+        assert balde.retirar()
+    assert 0.15 <= time.monotonic() - inicio < 1.0
+
+
+def test_quota_esgotada_salva_checkpoint_e_retoma(app, session, cosmos, tmp_path):
+    eans = _eans(10, base=7890000200000)
+    cosmos({e: _produto_cosmos(f"Produto {e}") for e in eans}, quota=4)
+    caminho = str(tmp_path / "coleta.json")
+
+    resumo = ColetaCosmos(limite=24, concorrencia=1, taxa_por_seg=500, checkpoint=caminho).executar(eans)
+    assert resumo["interrompido"] == "quota" and resumo["encontrados"] == 4
+    with open(caminho, encoding="utf-8") as f:
+        estado = json.load(f)
+    assert estado["chamadas"] == 5 and estado["pendentes"] == eans[4:]
+
+    # Dia seguinte (quota renovada): retoma só os pendentes, sem candidatos novos
+    estado["dia"] = "2000-01-01"
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(estado, f)
+    fake = cosmos({e: _produto_cosmos(f"Produto {e}") for e in eans})
+    resumo = ColetaCosmos(limite=24, concorrencia=2, taxa_por_seg=500, checkpoint=caminho).executar()
+    assert resumo["encontrados"] == 6 and resumo["pendentes"] == 0
+    assert sorted(p.rsplit("/", 1)[1][:13] for p in fake.requisicoes) == eans[4:]
+    assert _total_catalogo() == 10
+
+    # 429 com Retry-After curto não interrompe: pausa e tenta de novo
+    outro = _eans(2, base=7890000300000)
+    fake = cosmos({e: _produto_cosmos("X") for e in outro}, rejeitar_primeiras=1, retry_after=0.2)
+    inicio = time.monotonic()
+    resumo = ColetaCosmos(limite=3, concorrencia=1, taxa_por_seg=500).executar(outro)
+    assert resumo["interrompido"] is None and resumo["encontrados"] == 2
+    assert len(fake.requisicoes) == 3 and time.monotonic() - inicio >= 0.2
@@ -0,0 +1,178 @@
+"""
+Contingência NFC-e: com o gateway fora do ar a nota sai na hora com chave local
+(tpEmis 9), o transmissor envia o acumulado quando o gateway volta e os
+documentos "processando" são consultados em lote.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app.models import db, CategoriaProduto, DocumentoFiscal, Estabelecimento, Produto, Venda, utcnow
+from app.services.fiscal import gateways
+from app.services.fiscal.contingencia import ContingenciaService
+from app.services.fiscal.fila_emissao import FilaEmissaoNFCe
+from app.services.fiscal.gateways import SaudeGateway
+
+
+def _nova_venda(client, prod, headers):
+    resp = client.post("/api/vendas/", json={
+        "items": [{"productId": prod.id, "quantity": 1, "price": 8.00}],
+        "subtotal": 8.00, "total": 8.00,
+        "pagamentos": [{"forma_pagamento": "dinheiro", "valor": 8.00}],
+    }, headers=headers)
+    assert resp.status_code in (200, 201), resp.get_data(as_text=True)
+    return db.session.query(Venda).filter_by(codigo=resp.get_json()["venda"]["codigo"]).first()
+
+
+@pytest.fixture
+def ctx(client, session):
+    SaudeGateway.resetar()
+    estab = session.query(Estabelecimento).first()
+    cat = CategoriaProduto(nome="Bebidas", estabelecimento_id=estab.id)
+    session.add(cat)
+    session.flush()
+    prod = Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome="Refrigerante 2L",
+                   preco_custo=Decimal("5.00"), preco_venda=Decimal("8.00"), quantidade=100,
+                   ncm="22021000", cfop_padrao="5102", csosn="102")
+    session.add(prod)
+    session.commit()
+    token = create_access_token(identity="1", additional_claims={"estabelecimento_id": estab.id})
+    headers = {"Authorization": f"Bearer {token}"}
+    vendas = [_nova_venda(client, prod, headers) for _ in range(3)]
+    yield {"estab": estab, "vendas": vendas, "headers": headers}
+    SaudeGateway.resetar()
+
+
+def _derrubar_gateway(monkeypatch):
+    def _fora_do_ar(self, *args):
+        raise ConnectionError("SEFAZ indisponível")
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir", _fora_do_ar)
+    monkeypatch.setattr(gateways.SimuladoGateway, "consultar", _fora_do_ar)
+
+
+def _vencer_todos():
+    for doc in DocumentoFiscal.query.all():
+        doc.proxima_tentativa_em = utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+
+def test_gateway_fora_do_ar_emite_em_contingencia(client, ctx, monkeypatch):
+    original = gateways.SimuladoGateway.emitir
+    _derrubar_gateway(monkeypatch)
+    estab = ctx["estab"]
+
+    # Emissão síncrona: sem resposta do gateway a nota não vira "erro"
+    resp = client.post(f"/api/fiscal/vendas/{ctx['vendas'][0].id}/nfce", headers=ctx["headers"])
+    assert resp.status_code == 201, resp.get_data(as_text=True)
+    doc = resp.get_json()["documento"]
+    assert doc["status"] == "contingencia" and doc["contingencia_em"]
+    assert len(doc["chave_acesso"]) == 44 and doc["chave_acesso"][34] == "9"  # tpEmis 9 na chave
+
+    # Falhas seguidas abrem o disjuntor: a fila passa a emitir direto em contingência, sem tentar a rede
+    for _ in range(SaudeGateway.FALHAS_PARA_ABRIR):
+        SaudeGateway.registrar_falha(SaudeGateway.chave(estab))
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir", original)
+    d2 = FilaEmissaoNFCe.enfileirar(ctx["vendas"][1], estab, 1)
+    assert d2.status == "contingencia" and d2.chave_acesso[34] == "9"
+    assert ContingenciaService.transmitir(concorrencia=1)["enviados"] == 0  # disjuntor aberto: espera
+
+    fila = client.get("/api/fiscal/fila", headers=ctx["headers"]).get_json()["fila"]
+    assert fila["contingencia"] == 2 and fila["lacunas"] == []
+    assert fila["gateways"][SaudeGateway.chave(estab)]["aberto"] is True
+
+
+def test_queda_apos_envio_consulta_antes_da_contingencia(client, ctx, monkeypatch):
+    # A conexão cai depois de o gateway receber a nota: a consulta pela referência
+    # encontra a autorização e não há segunda emissão em contingência (tpEmis 9).
+    def _caiu_depois(self, payload, ref):
+        raise ConnectionError("conexão encerrada pelo servidor")
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir", _caiu_depois)
+    consultas = []
+    monkeypatch.setattr(gateways.SimuladoGateway, "consultar", lambda self, ref: consultas.append(ref) or {
+        "status": "autorizado", "protocolo": "135000000000002", "chave": "3" * 44})
+
+    resp = client.post(f"/api/fiscal/vendas/{ctx['vendas'][0].id}/nfce", headers=ctx["headers"])
+    doc = resp.get_json()["documento"]
+    assert resp.status_code == 201 and doc["status"] == "autorizado" and not doc["contingencia_em"]
+    assert doc["protocolo"] == "135000000000002"
+
+    # Fila: o gateway não conhece a nota ("erro") → segue o fluxo de falha de rede
+    monkeypatch.setattr(gateways.SimuladoGateway, "consultar", lambda self, ref: consultas.append(ref) or {
+        "status": "erro", "mensagem": "Nota não encontrada"})
+    d2 = FilaEmissaoNFCe.enfileirar(ctx["vendas"][1], ctx["estab"], 1)
+    assert FilaEmissaoNFCe.processar_pendentes() == {d2.id: "fila"}
+    assert consultas == [f"nfce-{ctx['estab'].id}-{ctx['vendas'][0].id}", d2.referencia]
+    assert client.get("/api/fiscal/fila", headers=ctx["headers"]).get_json()["fila"]["lacunas"] == []
+
+
+def test_transmissor_esvazia_contingencia_quando_gateway_volta(client, ctx, monkeypatch):
+    original, consultar = gateways.SimuladoGateway.emitir, gateways.SimuladoGateway.consultar
+    _derrubar_gateway(monkeypatch)
+    docs = [FilaEmissaoNFCe.enfileirar(v, ctx["estab"], 1) for v in ctx["vendas"]]
+    FilaEmissaoNFCe.processar_pendentes()
+    _vencer_todos()
+    FilaEmissaoNFCe.processar_pendentes()  # terceira falha abre o disjuntor → contingência
+    assert {db.session.get(DocumentoFiscal, d.id).status for d in docs} == {"contingencia"}
+    numeros = {d.id: d.numero for d in docs}
+    chaves = {d.id: d.chave_acesso for d in docs}
+
+    SaudeGateway.resetar()
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir", original)
+    monkeypatch.setattr(gateways.SimuladoGateway, "consultar", consultar)
+    _vencer_todos()
+    resp = client.post("/api/fiscal/contingencia/transmitir", headers=ctx["headers"])
+    body = resp.get_json()
+    assert resp.status_code == 200, body
+    assert body["resultado"]["por_status"] == {"autorizado": 3}
+    assert body["fila"]["contingencia"] == 0 and body["fila"]["estimativa_drenagem_seg"] == 0
+    assert body["fila"]["vazao_por_minuto"] > 0
+    for d in docs:
+        db.session.refresh(d)
+        assert d.status == "autorizado" and d.numero == numeros[d.id] and d.contingencia_em is not None
+        assert d.chave_acesso == chaves[d.id]  # a chave impressa no cupom é a autorizada
+
+
+def test_chave_divergente_do_gateway_nao_sobrescreve_a_de_contingencia(ctx, monkeypatch):
+    _derrubar_gateway(monkeypatch)
+    for _ in range(SaudeGateway.FALHAS_PARA_ABRIR):
+        SaudeGateway.registrar_falha(SaudeGateway.chave(ctx["estab"]))
+    doc = FilaEmissaoNFCe.enfileirar(ctx["vendas"][0], ctx["estab"], 1)
+    chave = doc.chave_acesso
+
+    enviados = []
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir", lambda self, payload, ref: enviados.append(payload) or {
+        "status": "autorizado", "chave": "3" * 44, "protocolo": "135000000000003"})
+    SaudeGateway.resetar()
+    _vencer_todos()
+    ContingenciaService.transmitir(concorrencia=1)
+
+    assert enviados[0]["chave_nfe"] == chave and enviados[0]["codigo_numerico"] == chave[35:43]
+    db.session.refresh(doc)
+    assert doc.status == "erro" and doc.chave_acesso == chave and "3" * 44 in doc.motivo_rejeicao
+
+
+def test_consulta_em_lote_dos_documentos_processando(ctx, monkeypatch):
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir",
+                        lambda self, payload, ref: {"status": "processando", "mensagem": "Em processamento"})
+    docs = [FilaEmissaoNFCe.enfileirar(v, ctx["estab"], 1) for v in ctx["vendas"]]
+    FilaEmissaoNFCe.processar_pendentes()
+    assert {d.status for d in docs} == {"processando"}
+
+    chamadas = []
+
+    def _lote(self, refs):
+        refs = list(refs)
+        chamadas.append(refs)
+        return {r: {"status": "autorizado", "protocolo": "135000000000001"} for r in refs}
+    monkeypatch.setattr(gateways.SimuladoGateway, "consultar_lote", _lote)
+    monkeypatch.setattr(gateways.SimuladoGateway, "consultar",
+                        lambda self, ref: pytest.fail("consulta deve ser em lote"))
+
+    assert ContingenciaService.consultar_pendentes() == {}  # ainda dentro do intervalo
+    _vencer_todos()
+    resultado = ContingenciaService.consultar_pendentes()
+    assert sorted(resultado) == sorted(d.id for d in docs)
+    assert set(resultado.values()) == {"autorizado"}
+    assert len(chamadas) == 1 and len(chamadas[0]) == 3
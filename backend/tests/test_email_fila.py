@@ -0,0 +1,131 @@
+"""
+Fila de e-mails: o cupom é renderizado e enfileirado, o envio sai por conexão
+SMTP reaproveitada (em lote) e falhas viram retry com backoff até o dead-letter.
+Tudo contra o SMTPSink local.
+"""
+import base64
+import socket
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app.models import db, Configuracao, EmailFila, Estabelecimento, utcnow
+from app.services import email_fila
+from app.services.email_fila import EmailFilaService, recarregar_configuracao
+from app.services.email_service import enviar_cupom_fiscal
+from app.services.smtp_sink import SMTPSink
+
+# PNG 1x1
+PNG = base64.b64encode(bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)).decode()
+
+
+def _porta_fechada():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def sink(app):
+    with SMTPSink() as sink:
+        app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=sink.porta, MAIL_USE_TLS=False,
+                          MAIL_USE_SSL=False, MAIL_USERNAME="loja@teste.com", MAIL_PASSWORD="segredo",
+                          MAIL_DEFAULT_SENDER="loja@teste.com")
+        recarregar_configuracao()
+        yield sink
+        recarregar_configuracao()
+
+
+def test_cupom_enfileirado_e_entregue_com_logo_da_loja(app, session, sink):
+    estab = session.query(Estabelecimento).first()
+    config = db.session.execute(select(Configuracao).filter_by(estabelecimento_id=estab.id)).scalar()
+    if config is None:
+        config = Configuracao(estabelecimento_id=estab.id)
+        session.add(config)
+    config.logo_base64 = f"data:image/png;base64,{PNG}"
+    session.commit()
+
+    venda_data = {
+        "venda": {"codigo": "V-0001", "data": "19/10/2026 10:00", "total": 12.5},
+        "comprovante": {
+            "itens": [{"nome": "Refrigerante 2L", "quantidade": 1, "preco_unitario": 12.5, "total": 12.5}],
+            "subtotal": 12.5, "desconto": 0, "total": 12.5, "forma_pagamento": "Pix",
+        },
+        "estabelecimento": {"nome_fantasia": "Mercadinho Teste"},
+    }
+    ok, erro = enviar_cupom_fiscal(venda_data, "cliente@exemplo.com", estab.id)
+    assert ok, erro
+
+    email = db.session.execute(select(EmailFila).filter_by(destinatario="cliente@exemplo.com")).scalar_one()
+    assert email.status == "enviado" and email.tipo == "cupom" and email.tentativas == 1
+    assert len(sink.mensagens) == 1
+    msg = sink.mensagens[0]
+    assert msg["destinatarios"] == ["cliente@exemplo.com"] and "V-0001" in msg["assunto"]
+    partes = {p.get_content_type(): p for p in msg["mensagem"].walk()}
+    assert "text/html" in partes and partes["image/png"]["Content-ID"] == "<logo_img>"
+
+
+def test_lote_sai_numa_conexao_e_recusa_definitiva_vai_para_dead_letter(app, session, sink, monkeypatch):
+    monkeypatch.setattr(EmailFilaService, "ativa", staticmethod(lambda: True))  # simula worker no ar
+    sink.recusar.add("inexistente@exemplo.com")
+    destinos = ["a@exemplo.com", "inexistente@exemplo.com", "b@exemplo.com", "c@exemplo.com"]
+    for destino in destinos:
+        EmailFilaService.enfileirar(destino, "Aviso", corpo_texto="Olá")
+    assert not sink.mensagens  # nada enviado na "requisição"
+
+    assert EmailFilaService.processar_pendentes() == {"enviado": 3, "falhou": 1}
+    assert sink.conexoes == 1 and len(sink.mensagens) == 3
+
+    EmailFilaService.enfileirar("d@exemplo.com", "Aviso", corpo_texto="Olá")
+    EmailFilaService.processar_pendentes()
+    assert sink.conexoes == 1 and len(sink.mensagens) == 4  # conexão do pool reaproveitada
+
+    recusado = db.session.execute(select(EmailFila).filter_by(destinatario="inexistente@exemplo.com")).scalar_one()
+    assert recusado.status == "falhou" and "550" in recusado.ultimo_erro
+    assert EmailFilaService.resumo() == {"pendente": 0, "enviado": 4, "falhou": 1, "pendente_mais_antigo": None}
+
+
+def test_servidor_fora_do_ar_reagenda_ate_dead_letter_e_reprocessa(app, session, sink, monkeypatch):
+    porta = sink.porta
+    app.config["MAIL_PORT"] = _porta_fechada()
+    recarregar_configuracao()
+    monkeypatch.setattr(email_fila, "_MAX_TENTATIVAS", 3)
+
+    email = EmailFilaService.enfileirar("cliente@exemplo.com", "Comprovante", corpo_texto="Olá")
+    assert email.status == "pendente" and email.tentativas == 1 and email.ultimo_erro
+    assert email.proxima_tentativa_em > utcnow()  # backoff: não tenta de novo na hora
+    assert EmailFilaService.processar_pendentes() == {}
+
+    for _ in range(2):
+        email.proxima_tentativa_em = utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        EmailFilaService.processar_pendentes()
+        db.session.refresh(email)
+    assert email.status == "falhou" and email.tentativas == 3
+
+    app.config["MAIL_PORT"] = porta
+    recarregar_configuracao()
+    assert EmailFilaService.reenviar_falhos() == 1
+    EmailFilaService.processar_pendentes()
+    db.session.refresh(email)
+    assert email.status == "enviado" and len(sink.mensagens) == 1
+
+
+def test_senha_provisoria_nao_fica_na_fila(app, session, sink):
+    from app.services.email_service import EmailService
+
+    EmailService.send_credentials_email("dono@exemplo.com", "Dono", "Tmp#4821", "Mercadinho Teste")
+    assert "Tmp#4821" in sink.mensagens[0]["mensagem"].as_string()
+    email = db.session.execute(select(EmailFila).filter_by(destinatario="dono@exemplo.com")).scalar_one()
+    assert email.status == "enviado" and email.corpo_texto is None and email.corpo_html is None
+
+    comum = EmailFilaService.enfileirar("cliente@exemplo.com", "Aviso", corpo_texto="Olá")
+    assert comum.corpo_texto == "Olá"
+    email.enviado_em = email.criado_em = utcnow() - timedelta(days=31)
+    session.commit()
+    assert EmailFilaService.purgar(30) == {"removidos": 1, "corpos_apagados": 0}
+    assert db.session.execute(select(EmailFila.destinatario)).scalars().all() == ["cliente@exemplo.com"]
@@ -0,0 +1,143 @@
+"""
+Importação de NF-e de entrada: XML lido em fluxo, produtos resolvidos em lote
+(custo médio, estoque e movimentações gravados de uma vez) e ZIP com várias
+notas, idempotente pela chave de acesso.
+"""
+import io
+import zipfile
+from decimal import Decimal
+
+import pytest
+from flask import g, has_request_context
+from sqlalchemy import event
+
+from app.models import (
+    db, CatalogoMestre, CategoriaProduto, Estabelecimento, HistoricoPrecos, MovimentacaoEstoque,
+    NotaFiscalEntrada, Produto,
+)
+from app.services.fiscal import entrada_service
+from app.services.fiscal.xml_parser import parse_nfe_xml
+
+NS = "http://www.portalfiscal.inf.br/nfe"
+
+
+def _xml_nfe(numero: int, itens, data="2026-09-01T10:00:00-03:00") -> bytes:
+    chave = f"1326091234567800019955001{numero:09d}1{numero:08d}"[:44].ljust(44, "0")
+    dets = "".join(
+        f'<det nItem="{i}"><prod><cProd>{cod}</cProd><cEAN>{ean or "SEM GTIN"}</cEAN>'
+        f"<xProd>{nome}</xProd><NCM>22021000</NCM><CFOP>5102</CFOP><uCom>UN</uCom>"
+        f"<qCom>{qtd}</qCom><vUnCom>{custo}</vUnCom><vProd>{qtd * custo:.2f}</vProd></prod></det>"
+        for i, (cod, ean, nome, qtd, custo) in enumerate(itens, 1)
+    )
+    total = sum(qtd * custo for _, _, _, qtd, custo in itens)
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="{NS}" versao="4.00">'
+        f'<NFe><infNFe Id="NFe{chave}" versao="4.00">'
+        f"<ide><mod>55</mod><serie>1</serie><nNF>{numero}</nNF><dhEmi>{data}</dhEmi><natOp>VENDA</natOp></ide>"
+        f"<emit><CNPJ>12345678000199</CNPJ><xNome>Distribuidora Norte</xNome><enderEmit><UF>AM</UF>"
+        f"<xMun>Manaus</xMun></enderEmit></emit>{dets}"
+        f"<total><ICMSTot><vProd>{total:.2f}</vProd><vNF>{total:.2f}</vNF></ICMSTot></total>"
+        f"</infNFe></NFe><protNFe><infProt><chNFe>{chave}</chNFe></infProt></protNFe></nfeProc>"
+    ).encode()
+
+
+@pytest.fixture
+def estab(session):
+    estab = session.query(Estabelecimento).first()
+    cat = CategoriaProduto(nome="Bebidas", estabelecimento_id=estab.id)
+    session.add(cat)
+    session.flush()
+    session.add(Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome="Refrigerante 2L",
+                        codigo_barras="7894900011517", preco_custo=Decimal("5.00"),
+                        preco_venda=Decimal("8.00"), quantidade=10))
+    session.commit()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    return estab
+
+
+def test_importar_resolve_produtos_em_lote_e_aplica_cmp(estab):
+    xml = _xml_nfe(1, [
+        ("A1", "7894900011517", "REFRIG 2L", 10, 7.0),     # existente: CMP 5→6
+        ("B2", "7891000100103", "BISCOITO", 4, 2.5),       # novo (EAN)
+        ("B2", "7891000100103", "BISCOITO", 6, 3.0),       # mesmo produto novo, outro custo
+        ("C3", None, "PRODUTO SEM GTIN", 2, 1.0),          # novo (só código)
+    ])
+    parsed = parse_nfe_xml(xml)
+    assert [it["codigo"] for it in parsed["itens"]] == ["A1", "B2", "B2", "C3"]
+
+    selects, eventos = [], []
+
+    def _contar(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM produtos" in statement:
+            selects.append(statement)
+
+    def _evento_orm(mapper, connection, target):  # onde a auditoria forense e a sincronia se penduram
+        eventos.append((target.__tablename__, target.id))
+    event.listen(db.engine, "before_cursor_execute", _contar)
+    event.listen(Produto, "after_update", _evento_orm)
+    event.listen(MovimentacaoEstoque, "after_insert", _evento_orm)
+    try:
+        res = entrada_service.importar(parsed, xml.decode(), estab.id, 1)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _contar)
+        event.remove(Produto, "after_update", _evento_orm)
+        event.remove(MovimentacaoEstoque, "after_insert", _evento_orm)
+    assert len(selects) == 1  # um SELECT ... IN para todos os itens
+    assert sum(t == "movimentacoes_estoque" for t, _ in eventos) == 4
+    assert (res["produtos_criados"], res["produtos_atualizados"]) == (2, 2)
+
+    refri = db.session.query(Produto).filter_by(codigo_barras="7894900011517").one()
+    assert refri.quantidade == 20 and refri.preco_custo == Decimal("6.00")
+    assert ("produtos", refri.id) in eventos
+    biscoito = db.session.query(Produto).filter_by(codigo_barras="7891000100103").one()
+    assert biscoito.quantidade == 10 and biscoito.preco_custo == Decimal("2.80")
+    assert db.session.query(Produto).filter_by(codigo_interno="C3").one().quantidade == 2
+
+    movs = db.session.query(MovimentacaoEstoque).filter_by(produto_id=biscoito.id).order_by(MovimentacaoEstoque.id).all()
+    assert [(m.quantidade_anterior, m.quantidade_atual) for m in movs] == [(0, 4), (4, 10)]
+    assert db.session.query(HistoricoPrecos).filter_by(produto_id=refri.id).count() == 1
+    assert db.session.query(CatalogoMestre).filter_by(ean="7891000100103").count() == 1
+
+
+def test_importar_lote_zip_idempotente_por_chave(client, estab):
+    nota_1 = _xml_nfe(10, [("A1", "7894900011517", "REFRIG 2L", 5, 5.0)], data="2026-09-02T10:00:00-03:00")
+    nota_2 = _xml_nfe(11, [("A1", "7894900011517", "REFRIG 2L", 5, 8.0)], data="2026-09-01T10:00:00-03:00")
+    entrada_service.importar(parse_nfe_xml(nota_1), nota_1.decode(), estab.id, 1)
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("setembro/nota10.xml", nota_1)        # já importada
+        zf.writestr("setembro/nota11.xml", nota_2)
+        zf.writestr("setembro/nota11-copia.xml", nota_2)  # repetida no próprio ZIP
+        zf.writestr("setembro/quebrado.xml", b"<NFe><infNFe>")
+        zf.writestr("leia-me.txt", b"ignorar")
+    resultado = entrada_service.importar_lote(buf.getvalue(), estab.id, 1)
+
+    assert resultado["arquivos"] == 4 and resultado["importadas"] == 1, resultado
+    assert sorted(d["arquivo"] for d in resultado["duplicadas"]) == ["setembro/nota10.xml",
+                                                                    "setembro/nota11-copia.xml"]
+    assert [e["arquivo"] for e in resultado["erros"]] == ["setembro/quebrado.xml"]
+    assert db.session.query(NotaFiscalEntrada).filter_by(estabelecimento_id=estab.id).count() == 2
+    assert db.session.query(Produto).filter_by(codigo_barras="7894900011517").one().quantidade == 20
+
+
+def test_rota_importar_lote(client, estab):
+    from flask_jwt_extended import create_access_token
+
+    headers = {"Authorization": "Bearer " + create_access_token(
+        identity="1", additional_claims={"estabelecimento_id": estab.id})}
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for n in (20, 21, 22):
+            zf.writestr(f"nota{n}.xml", _xml_nfe(n, [(f"X{n}", None, f"ITEM {n}", 1, 3.0)]))
+    resp = client.post("/api/fiscal/entrada/importar-lote",
+                       data={"zip": (io.BytesIO(buf.getvalue()), "notas.zip")},
+                       headers=headers, content_type="multipart/form-data")
+    body = resp.get_json()
+    assert resp.status_code == 200, body
+    assert body["resultado"]["importadas"] == 3 and body["resultado"]["produtos_criados"] == 3
+
+    resp = client.post("/api/fiscal/entrada/importar-lote", data=b"nao sou zip", headers=headers,
+                       content_type="application/zip")
+    assert resp.status_code == 400
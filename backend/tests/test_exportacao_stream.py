@@ -0,0 +1,144 @@
+"""
+Exportações em stream: CSV lido em lotes (yield_per) e escrito em blocos na
+resposta, XLSX via workbook write-only em arquivo temporário e jobs em
+background com arquivo para download — sempre com os filtros da listagem.
+"""
+import csv
+import io
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from flask_jwt_extended import create_access_token
+from openpyxl import load_workbook
+from sqlalchemy import select
+
+from app.models import (
+    db, CategoriaProduto, Cliente, Estabelecimento, ExportacaoArquivo, Funcionario, Pagamento, Produto,
+    Venda, VendaItem,
+)
+from app.services import exportacao_service
+
+
+@pytest.fixture
+def loja(app, session, tmp_path):
+    app.config["EXPORTACAO_FOLDER"] = str(tmp_path)
+    estab = session.query(Estabelecimento).first()
+    func = db.session.execute(select(Funcionario).filter_by(estabelecimento_id=estab.id)).scalars().first()
+    headers = {"Authorization": "Bearer " + create_access_token(
+        identity=str(func.id), additional_claims={"estabelecimento_id": estab.id, "role": "admin"})}
+    return estab, func, headers
+
+
+ENDERECO = dict(cep="69000-000", logradouro="Rua A", numero="1", bairro="Centro", cidade="Manaus", estado="AM")
+
+
+def _csv(texto, delimitador=";"):
+    return list(csv.reader(io.StringIO(texto.lstrip("\ufeff")), delimiter=delimitador))
+
+
+def test_produtos_saem_em_blocos_com_os_filtros_da_listagem(client, session, loja, monkeypatch):
+    estab, _, headers = loja
+    monkeypatch.setattr(exportacao_service, "_LOTE", 5)
+    bebidas = CategoriaProduto(estabelecimento_id=estab.id, nome="Bebidas")
+    limpeza = CategoriaProduto(estabelecimento_id=estab.id, nome="Limpeza")
+    session.add_all([bebidas, limpeza])
+    session.flush()
+    for i in range(12):
+        session.add(Produto(estabelecimento_id=estab.id, categoria_id=bebidas.id, nome=f"Suco {i:02d}",
+                            preco_custo=Decimal("2"), preco_venda=Decimal("3"), quantidade=i))
+    session.add(Produto(estabelecimento_id=estab.id, categoria_id=limpeza.id, nome="Sabão",
+                        preco_custo=Decimal("1"), preco_venda=Decimal("2"), quantidade=3))
+    session.add(Produto(estabelecimento_id=estab.id, categoria_id=bebidas.id, nome="Suco antigo",
+                        preco_custo=Decimal("1"), preco_venda=Decimal("2"), ativo=False))
+    session.commit()
+
+    resp = client.get("/api/produtos/exportar?categoria=Bebidas", headers=headers)
+    assert resp.status_code == 200 and resp.is_streamed
+    assert resp.headers["Content-Type"].startswith("text/csv")
+    blocos = list(resp.response)
+    assert len(blocos) == 3  # 12 linhas em blocos de 5, não num buffer único
+    linhas = _csv(b"".join(blocos).decode())
+    assert linhas[0][:4] == ["ID", "Código Barras", "Código Interno", "Nome"] and len(linhas[0]) == 26
+    assert [l[3] for l in linhas[1:]] == [f"Suco {i:02d}" for i in range(12)]  # só ativos, por nome
+
+    resp = client.get("/api/produtos/exportar?categoria=Bebidas&estoque_status=normal&ordenar_por=quantidade"
+                      "&direcao=desc", headers=headers)
+    linhas = _csv(resp.get_data(as_text=True))
+    # Ativos (padrão da exportação), categoria Bebidas e quantidade > mínima (10): Suco 11
+    assert [(l[3], l[6], l[13]) for l in linhas[1:]] == [("Suco 11", "Bebidas", "50.0")]
+
+    resp = client.get("/api/produtos/exportar/csv?ativos=false", headers=headers)
+    corpo = resp.get_json()
+    assert corpo["total_produtos"] == 1 and _csv(corpo["csv"], ",")[1][1] == "Suco antigo"
+
+
+def test_clientes_em_excel_usam_workbook_write_only(client, session, loja):
+    estab, _, headers = loja
+    session.add_all([
+        Cliente(estabelecimento_id=estab.id, nome="Ana Premium", cpf="52998224725", celular="92999990001",
+                valor_total_gasto=Decimal("15000"), total_compras=30, limite_credito=Decimal("500"),
+                saldo_devedor=Decimal("120"), **ENDERECO),
+        Cliente(estabelecimento_id=estab.id, nome="Bruno Novo", cpf="11144477735", celular="92999990002",
+                total_compras=0, **ENDERECO),
+    ])
+    session.commit()
+
+    resp = client.get("/api/clientes/exportar?formato=excel&classificacao=PREMIUM", headers=headers)
+    assert resp.status_code == 200
+    assert resp.headers["Content-Type"] == exportacao_service.MIMETYPE_XLSX
+    planilha = load_workbook(io.BytesIO(resp.data), read_only=True)["Clientes"]
+    linhas = list(planilha.values)
+    resp.close()
+    assert len(linhas[0]) == 29 and linhas[0][1] == "Nome"
+    assert len(linhas) == 2 and linhas[1][1] == "Ana Premium"
+    assert linhas[1][19] == 380 and linhas[1][22] == 500 and linhas[1][24] == "PREMIUM"
+
+    resp = client.get("/api/clientes/exportar?formato=pdf", headers=headers)
+    assert resp.status_code == 400
+
+
+def test_vendas_grandes_viram_job_com_arquivo_para_download(client, session, loja):
+    estab, func, headers = loja
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Geral")
+    session.add(cat)
+    session.flush()
+    produto = Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome="Arroz",
+                      preco_custo=Decimal("4"), preco_venda=Decimal("6"))
+    session.add(produto)
+    session.flush()
+    for i, status in enumerate(["finalizada", "finalizada", "cancelada"]):
+        venda = Venda(estabelecimento_id=estab.id, funcionario_id=func.id, codigo=f"V-{i}", status=status,
+                      subtotal=Decimal("12"), total=Decimal("12"), data_venda=datetime(2026, 10, 1 + i, 15))
+        session.add(venda)
+        session.flush()
+        session.add_all([
+            VendaItem(estabelecimento_id=estab.id, venda_id=venda.id, produto_id=produto.id, produto_nome="Arroz", quantidade=2,
+                      preco_unitario=Decimal("6"), total_item=Decimal("12")),
+            Pagamento(estabelecimento_id=estab.id, venda_id=venda.id, forma_pagamento="pix", valor=Decimal("12")),
+        ])
+    session.commit()
+
+    resp = client.get("/api/vendas/exportar?assincrono=true&ordenar_por=codigo&direcao=asc", headers=headers)
+    assert resp.status_code == 202
+    job = resp.get_json()["exportacao"]
+    assert job["status"] == "pronto" and job["linhas"] == 2  # sem workers: processado em linha
+
+    resp = client.get(job["status_url"], headers=headers)
+    assert resp.get_json()["exportacao"]["download_url"] == job["download_url"]
+    resp = client.get(job["download_url"], headers=headers)
+    linhas = _csv(resp.data.decode("utf-8"))
+    resp.close()
+    assert linhas[0][0] == "Código"
+    assert [l[0] for l in linhas[1:]] == ["V-0", "V-1"]  # canceladas ficam fora, como na listagem
+    assert linhas[1][7] == "pix" and linhas[1][9] == "1"
+
+    assert exportacao_service.ExportacaoService.localizar(job["handle"], estab.id + 1) is None  # outra loja
+
+    registro = db.session.execute(select(ExportacaoArquivo).filter_by(handle=job["handle"])).scalar_one()
+    registro.expira_em = datetime(2000, 1, 1)
+    db.session.commit()
+    caminho = registro.caminho
+    assert exportacao_service.ExportacaoService.limpar_expirados() == 1
+    assert not os.path.exists(caminho)
@@ -0,0 +1,135 @@
+"""
+Fila de emissão de NFC-e: o número é reservado na hora (sequência atômica por
+série, sem repetir entre caixas), o envio ao gateway acontece fora do checkout
+com retry/backoff, e número que não vira nota autorizada fica como lacuna.
+"""
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app.models import db, CategoriaProduto, DocumentoFiscal, Estabelecimento, Produto, Venda, utcnow
+from app.services.fiscal import fila_emissao, gateways
+from app.services.fiscal.fila_emissao import FilaEmissaoNFCe
+
+
+def _nova_venda(client, estab, prod, headers):
+    resp = client.post("/api/vendas/", json={
+        "items": [{"productId": prod.id, "quantity": 1, "price": 8.00}],
+        "subtotal": 8.00, "total": 8.00,
+        "pagamentos": [{"forma_pagamento": "dinheiro", "valor": 8.00}],
+    }, headers=headers)
+    assert resp.status_code in (200, 201), resp.get_data(as_text=True)
+    return db.session.query(Venda).filter_by(codigo=resp.get_json()["venda"]["codigo"]).first()
+
+
+@pytest.fixture
+def ctx(client, session):
+    estab = session.query(Estabelecimento).first()
+    cat = CategoriaProduto(nome="Bebidas", estabelecimento_id=estab.id)
+    session.add(cat)
+    session.flush()
+    prod = Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome="Refrigerante 2L",
+                   preco_custo=Decimal("5.00"), preco_venda=Decimal("8.00"), quantidade=100,
+                   ncm="22021000", cfop_padrao="5102", csosn="102")
+    session.add(prod)
+    session.commit()
+    token = create_access_token(identity="1", additional_claims={"estabelecimento_id": estab.id})
+    headers = {"Authorization": f"Bearer {token}"}
+    vendas = [_nova_venda(client, estab, prod, headers) for _ in range(2)]
+    return {"estab": estab, "vendas": vendas, "headers": headers}
+
+
+def _vencer(doc_id):
+    doc = db.session.get(DocumentoFiscal, doc_id)
+    doc.proxima_tentativa_em = utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+
+def test_enfileirar_reserva_numeros_sem_chamar_gateway(ctx, monkeypatch):
+    def _nao_chamar(self, payload, ref):
+        raise AssertionError("checkout não pode esperar o gateway")
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir", _nao_chamar)
+
+    estab = ctx["estab"]
+    inicial = int(estab.proximo_numero_nfce or 1)
+    d1 = FilaEmissaoNFCe.enfileirar(ctx["vendas"][0], estab, 1)
+    d2 = FilaEmissaoNFCe.enfileirar(ctx["vendas"][1], estab, 1)
+    assert (d1.status, d2.status) == ("fila", "fila")
+    assert (int(d1.numero), int(d2.numero)) == (inicial, inicial + 1)
+
+    # Idempotente: reenfileirar a mesma venda não gasta outro número
+    assert FilaEmissaoNFCe.enfileirar(ctx["vendas"][0], estab, 1).id == d1.id
+    db.session.refresh(estab)
+    assert int(estab.proximo_numero_nfce) == inicial + 2
+
+
+def test_worker_reagenda_falha_e_autoriza_depois(client, ctx, monkeypatch):
+    doc = FilaEmissaoNFCe.enfileirar(ctx["vendas"][0], ctx["estab"], 1)
+    original, consultar = gateways.SimuladoGateway.emitir, gateways.SimuladoGateway.consultar
+
+    def _fora_do_ar(self, *args):
+        raise ConnectionError("SEFAZ indisponível")
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir", _fora_do_ar)
+    monkeypatch.setattr(gateways.SimuladoGateway, "consultar", _fora_do_ar)
+    assert FilaEmissaoNFCe.processar_pendentes() == {doc.id: "fila"}
+    db.session.refresh(doc)
+    assert doc.tentativas == 1 and doc.proxima_tentativa_em > utcnow()
+    assert FilaEmissaoNFCe.processar_pendentes() == {}  # ainda em backoff
+
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir", original)
+    monkeypatch.setattr(gateways.SimuladoGateway, "consultar", consultar)
+    _vencer(doc.id)
+    assert FilaEmissaoNFCe.processar_pendentes() == {doc.id: "autorizado"}
+
+    resp = client.get(f"/api/fiscal/documentos/{doc.id}/status?aguardar=1", headers=ctx["headers"])
+    body = resp.get_json()
+    assert body["status"] == "autorizado" and len(body["chave_acesso"]) == 44
+    assert body["tentativas"] == 2
+
+
+def test_rejeicao_vira_lacuna_e_reemissao_reaproveita_numero(client, ctx, monkeypatch):
+    doc = FilaEmissaoNFCe.enfileirar(ctx["vendas"][0], ctx["estab"], 1)
+    original = gateways.SimuladoGateway.emitir
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir",
+                        lambda self, payload, ref: {"status": "rejeitado", "mensagem": "Rejeição 778: NCM"})
+    assert FilaEmissaoNFCe.processar_pendentes() == {doc.id: "rejeitado"}
+
+    fila = client.get("/api/fiscal/fila", headers=ctx["headers"]).get_json()["fila"]
+    assert fila["rejeitado"] == 1
+    assert [l["numero"] for l in fila["lacunas"]] == [int(doc.numero)]
+
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir", original)
+    resp = client.post(f"/api/fiscal/vendas/{ctx['vendas'][0].id}/nfce", headers=ctx["headers"])
+    assert resp.status_code == 201, resp.get_data(as_text=True)
+    assert resp.get_json()["documento"]["numero"] == doc.numero
+    assert client.get("/api/fiscal/fila", headers=ctx["headers"]).get_json()["fila"]["lacunas"] == []
+
+
+def test_erro_de_transporte_consulta_e_nao_vira_lacuna(client, ctx, monkeypatch):
+    monkeypatch.setattr(fila_emissao, "_MAX_TENTATIVAS", 1)
+    monkeypatch.setattr(gateways.SimuladoGateway, "emitir",
+                        lambda self, payload, ref: {"status": "erro", "mensagem": "HTTP 502"})
+    monkeypatch.setattr(gateways.SimuladoGateway, "consultar",
+                        lambda self, ref: {"status": "erro", "mensagem": "HTTP 502"})
+    d1 = FilaEmissaoNFCe.enfileirar(ctx["vendas"][0], ctx["estab"], 1)
+    assert FilaEmissaoNFCe.processar_pendentes() == {d1.id: "erro"}
+    assert client.get("/api/fiscal/fila", headers=ctx["headers"]).get_json()["fila"]["lacunas"] == []
+
+    # A consulta encontra a nota que o envio "perdeu": vale o que o gateway sabe
+    monkeypatch.setattr(gateways.SimuladoGateway, "consultar",
+                        lambda self, ref: {"status": "autorizado", "protocolo": "135000000000003"})
+    d2 = FilaEmissaoNFCe.enfileirar(ctx["vendas"][1], ctx["estab"], 1)
+    assert FilaEmissaoNFCe.processar_pendentes() == {d2.id: "autorizado"}
+    assert db.session.get(DocumentoFiscal, d2.id).protocolo == "135000000000003"
+
+
+def test_long_poll_limitado(client, ctx, monkeypatch):
+    monkeypatch.setattr(fila_emissao, "_AGUARDAR_MAX_SEC", 0.2)
+    doc = FilaEmissaoNFCe.enfileirar(ctx["vendas"][0], ctx["estab"], 1)
+    inicio = time.monotonic()
+    resp = client.get(f"/api/fiscal/documentos/{doc.id}/status?aguardar=30", headers=ctx["headers"])
+    assert resp.get_json()["status"] == "fila"
+    assert time.monotonic() - inicio < 2
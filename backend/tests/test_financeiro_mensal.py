@@ -0,0 +1,215 @@
+"""
+Razão financeiro mensal (financeiro_mensal): deltas aplicados a cada flush de
+despesas, contas e vendas, leitura dos meses inteiros pelos endpoints de
+despesas e acerto (reconciliar) de escritas feitas fora do ORM.
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from flask import g, has_request_context
+from flask_jwt_extended import create_access_token
+
+from app.models import (
+    db, CategoriaProduto, ContaPagar, ContaReceber, Despesa, Estabelecimento, FinanceiroMensal, Fornecedor,
+    Funcionario, Produto, Venda, VendaItem,
+)
+from app.services import backup_stream
+from app.services.financeiro_mensal_service import (
+    CMV, DESPESA, DESPESA_RECORRENTE, PAGAR_ABERTO, PAGAR_PAGO, RECEBER_ABERTO, RECEITA, VENDAS_RECEBIDO,
+    FinanceiroMensalService, fim_do_mes, meses_inteiros,
+)
+from app.utils.timezone import hoje_local
+
+MARCO, ABRIL = date(2025, 3, 1), date(2025, 4, 1)
+
+
+@pytest.fixture
+def ctx(session):
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    admin = session.query(Funcionario).filter_by(estabelecimento_id=estab.id).first()
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Mercearia")
+    fornecedor = Fornecedor(estabelecimento_id=estab.id, nome_fantasia="Atacadão", razao_social="Atacadão LTDA",
+                            cnpj="12345678000190", telefone="9233330000", email="a@atacadao.com", cep="69000-000",
+                            logradouro="Rua X", numero="1", bairro="Centro", cidade="Manaus", estado="AM",
+                            pais="Brasil")
+    session.add_all([cat, fornecedor])
+    session.flush()
+    produto = Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome="Arroz", preco_custo=Decimal("4"),
+                      preco_venda=Decimal("10"), quantidade=50)
+    session.add(produto)
+    session.commit()
+    FinanceiroMensalService.invalidar(estab.id)
+    FinanceiroMensalService.reconciliar_estabelecimento(estab.id)  # daqui em diante, só deltas
+    token = create_access_token(identity=str(admin.id), additional_claims={
+        "estabelecimento_id": estab.id, "role": "admin",
+    })
+    return {"estab": estab, "admin": admin, "produto": produto, "fornecedor": fornecedor,
+            "headers": {"Authorization": f"Bearer {token}"}}
+
+
+def _razao(estab_id):
+    return {(r.competencia, r.rubrica, r.categoria): float(r.valor)
+            for r in FinanceiroMensal.query.filter_by(estabelecimento_id=estab_id).all()}
+
+
+def _venda(ctx, codigo, quando, qtd, custo=None):
+    produto = ctx["produto"]
+    total = Decimal("10") * qtd
+    venda = Venda(estabelecimento_id=ctx["estab"].id, funcionario_id=ctx["admin"].id, codigo=codigo,
+                  subtotal=total, total=total, valor_recebido=total, status="finalizada", data_venda=quando)
+    venda.itens.append(VendaItem(estabelecimento_id=ctx["estab"].id, produto_id=produto.id, produto_nome=produto.nome,
+                                 quantidade=qtd, preco_unitario=10, total_item=total, custo_unitario=custo,
+                                 created_at=quando))
+    return venda
+
+
+def test_deltas_acompanham_escritas_do_orm(session, ctx):
+    estab_id = ctx["estab"].id
+    aluguel = Despesa(estabelecimento_id=estab_id, descricao="Aluguel", categoria="Aluguel", tipo="fixa",
+                      valor=Decimal("1000"), recorrente=True, data_despesa=date(2025, 3, 5))
+    espelho = Despesa(estabelecimento_id=estab_id, descricao="Boleto", categoria="Fornecedores", tipo="variavel",
+                      valor=Decimal("500"), data_despesa=date(2025, 3, 8))
+    conta = ContaPagar(estabelecimento_id=estab_id, fornecedor_id=ctx["fornecedor"].id, numero_documento="NF-1",
+                       valor_original=Decimal("800"), valor_atual=Decimal("800"),
+                       data_emissao=date(2025, 3, 1), data_vencimento=date(2025, 3, 20))
+    receber = ContaReceber(estabelecimento_id=estab_id, numero_documento="CR-1", valor_original=Decimal("300"),
+                           valor_atual=Decimal("300"), data_emissao=date(2025, 3, 1),
+                           data_vencimento=date(2025, 3, 15))
+    session.add_all([aluguel, espelho, conta, receber,
+                     _venda(ctx, "FM-1", datetime(2025, 3, 10, 15), 2),                  # custo pelo produto
+                     _venda(ctx, "FM-2", datetime(2025, 4, 1, 2), 1, Decimal("6"))])  # 31/03 no fuso local
+    session.commit()
+
+    razao = _razao(estab_id)
+    assert razao[(MARCO, DESPESA, "Aluguel")] == 1000.0
+    assert razao[(MARCO, DESPESA_RECORRENTE, "Aluguel")] == 1000.0
+    assert razao[(MARCO, DESPESA, "Fornecedores")] == 500.0
+    assert razao[(MARCO, PAGAR_ABERTO, "")] == 800.0
+    assert razao[(MARCO, RECEBER_ABERTO, "")] == 300.0
+    assert (razao[(MARCO, RECEITA, "")], razao[(MARCO, VENDAS_RECEBIDO, "")], razao[(MARCO, CMV, "")]) == \
+        (30.0, 30.0, 14.0)
+
+    # Atualização, mudança de mês, baixa do boleto, item novo, cancelamento e exclusão
+    aluguel.valor = Decimal("1200")
+    espelho.data_despesa = date(2025, 4, 2)
+    conta.status, conta.valor_pago, conta.data_pagamento = "pago", Decimal("800"), date(2025, 4, 3)
+    venda = Venda.query.filter_by(codigo="FM-1").one()
+    venda.itens.append(VendaItem(estabelecimento_id=estab_id, produto_id=ctx["produto"].id, produto_nome="Arroz",
+                                 quantidade=1, preco_unitario=10, total_item=10, custo_unitario=Decimal("5"),
+                                 created_at=venda.data_venda))
+    venda.total = venda.valor_recebido = Decimal("30")
+    Venda.query.filter_by(codigo="FM-2").one().status = "cancelada"
+    session.delete(receber)
+    session.commit()
+
+    razao = FinanceiroMensalService.ler(estab_id, MARCO, ABRIL)
+    assert razao.valor(DESPESA, [MARCO]) == Decimal("1200")
+    assert razao.valor(DESPESA, [ABRIL]) == Decimal("500")
+    assert razao.despesas([ABRIL])["despesas_operacionais"] == 0.0  # espelho de boleto fica fora
+    assert (razao.valor(PAGAR_ABERTO, [MARCO]), razao.valor(PAGAR_PAGO, [ABRIL])) == (0, Decimal("800"))
+    assert razao.valor(RECEBER_ABERTO) == 0
+    assert razao.vendas([MARCO]) == {"revenue": 30.0, "cogs": 13.0, "gross_profit": 17.0, "count": 1,
+                                     "total_recebido": 30.0}
+    assert razao.quantidade(RECEITA) == 1
+
+    conferencia = FinanceiroMensalService.reconciliar(estab_id, [MARCO, ABRIL], corrigir=False)
+    assert conferencia["consistente"], conferencia["divergencias"]
+
+
+def test_endpoints_leem_meses_inteiros_do_razao(client, session, ctx):
+    estab_id = ctx["estab"].id
+    assert meses_inteiros(date(2025, 3, 1), date(2025, 4, 30)) == [MARCO, ABRIL]
+    assert meses_inteiros(date(2025, 3, 2), date(2025, 4, 30)) is None
+
+    session.add_all([
+        Despesa(estabelecimento_id=estab_id, descricao="Luz", categoria="Energia", tipo="fixa",
+                valor=Decimal("250"), data_despesa=date(2025, 3, 12)),
+        Despesa(estabelecimento_id=estab_id, descricao="Luz", categoria="Energia", tipo="fixa",
+                valor=Decimal("300"), data_despesa=date(2025, 4, 12)),
+    ])
+    session.commit()
+
+    # Prova de que a leitura vem do razão: uma linha só dele aparece na resposta
+    FinanceiroMensal.query.filter_by(estabelecimento_id=estab_id, competencia=ABRIL, rubrica=DESPESA,
+                                     categoria="Energia").one().valor = Decimal("320")
+    session.commit()
+
+    resp = client.get("/api/despesas/resumo-financeiro/", headers=ctx["headers"],
+                      query_string={"data_inicio": "2025-04-01", "data_fim": "2025-04-30"})
+    assert resp.status_code == 200
+    assert resp.get_json()["dre_consolidado"]["despesas_operacionais"] == pytest.approx(320.0)
+
+    resp = client.get("/api/despesas/estatisticas", headers=ctx["headers"],
+                      query_string={"inicio": "2025-03-01", "fim": "2025-04-30"})
+    assert resp.status_code == 200
+    categorias = {c["categoria"]: c["total"] for c in resp.get_json()["estatisticas"]["despesas_por_categoria"]}
+    assert categorias["Energia"] == pytest.approx(570.0)
+
+    resp = client.get("/api/despesas/financeiro-mensal?meses=24", headers=ctx["headers"])
+    assert resp.status_code == 200
+    serie = {m["mes"]: m for m in resp.get_json()["meses"]}
+    assert serie["2025-04"]["totais"]["despesas"] == pytest.approx(320.0)
+    assert serie["2025-04"]["variacao_percentual"]["despesas"] == pytest.approx(28.0)
+
+
+def test_reconciliacao_corrige_escrita_fora_do_orm(app, session, ctx):
+    estab_id = ctx["estab"].id
+    session.add(Despesa(estabelecimento_id=estab_id, descricao="Internet", categoria="Internet", tipo="fixa",
+                        valor=Decimal("100"), data_despesa=date(2025, 3, 3)))
+    session.commit()
+
+    # UPDATE em massa no Core: não passa pelos listeners do flush
+    db.session.execute(Despesa.__table__.update().where(Despesa.__table__.c.estabelecimento_id == estab_id,
+                                                        Despesa.__table__.c.categoria == "Internet")
+                       .values(valor=Decimal("150")))
+    session.commit()
+    conferencia = FinanceiroMensalService.reconciliar(estab_id, [MARCO], corrigir=False)
+    assert not conferencia["consistente"]
+    assert [(d["rubrica"], d["origem"]["valor"], d["razao"]["valor"]) for d in conferencia["divergencias"]] == \
+        [(DESPESA, 150.0, 100.0)]
+
+    saida = app.test_cli_runner().invoke(args=["reconciliar-financeiro", "--estabelecimento-id", str(estab_id),
+                                               "--tudo"]).output
+    assert f"[DIVERGENTE] estabelecimento {estab_id}" in saida
+    assert _razao(estab_id)[(MARCO, DESPESA, "Internet")] == 150.0
+    assert FinanceiroMensalService.reconciliar(estab_id, [MARCO], corrigir=False)["consistente"]
+
+
+def test_leitura_de_loja_nao_reconciliada_nao_grava(session, ctx):
+    estab_id = ctx["estab"].id
+    FinanceiroMensal.query.filter_by(estabelecimento_id=estab_id).delete()
+    db.session.execute(Despesa.__table__.insert().values(
+        estabelecimento_id=estab_id, descricao="Água", categoria="Água", tipo="fixa", valor=Decimal("80"),
+        data_despesa=date(2025, 3, 9), recorrente=False))
+    session.commit()
+    FinanceiroMensalService.invalidar(estab_id)
+
+    razao = FinanceiroMensalService.ler(estab_id, MARCO, ABRIL)
+    assert razao.valor(DESPESA, [MARCO]) == Decimal("80")
+    assert MARCO in FinanceiroMensalService.folha(estab_id, [MARCO], razao)
+    session.rollback()
+    assert FinanceiroMensal.query.filter_by(estabelecimento_id=estab_id).count() == 0
+
+
+def test_restauro_e_acerto_noturno_mantem_o_razao(session, ctx):
+    estab_id = ctx["estab"].id
+    # Restauro de backup: upsert direto na tabela, razão refeito ao final
+    resumo = {"despesas": backup_stream.restaurar_linhas("despesas", [{
+        "id": 9001, "estabelecimento_id": estab_id, "descricao": "Aluguel antigo", "categoria": "Aluguel",
+        "tipo": "fixa", "valor": "700", "data_despesa": "2025-03-05", "recorrente": False,
+    }], estab_id)}
+    session.commit()
+    backup_stream.reconciliar_razao(resumo, estab_id)
+    assert _razao(estab_id)[(MARCO, DESPESA, "Aluguel")] == 700.0
+
+    # Conta a receber fora do ORM vencendo daqui a dois meses: o acerto noturno alcança o mês futuro
+    vencimento = fim_do_mes(fim_do_mes(hoje_local()) + timedelta(days=1)) + timedelta(days=10)
+    db.session.execute(ContaReceber.__table__.insert().values(
+        estabelecimento_id=estab_id, numero_documento="MIG-1", valor_original=Decimal("90"),
+        valor_atual=Decimal("90"), data_emissao=hoje_local(), data_vencimento=vencimento, status="aberto"))
+    session.commit()
+    FinanceiroMensalService.reconciliar_recentes()
+    assert _razao(estab_id)[(vencimento.replace(day=1), RECEBER_ABERTO, "")] == 90.0
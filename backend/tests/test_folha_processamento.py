@@ -0,0 +1,138 @@
+"""
+Processamento da folha em lote (folha_service): a loja inteira calculada de uma
+vez sobre o consolidado do ponto, snapshot imutável servido pelas rotas de RH e
+reprocessamento incremental (só quem teve as entradas alteradas).
+"""
+from datetime import date, time
+from decimal import Decimal
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app.models import (
+    db, Beneficio, ConfiguracaoHorario, Estabelecimento, FolhaProcessamento, Funcionario,
+    FuncionarioBeneficio, RegistroPonto,
+)
+from app.services.folha_service import FolhaService
+from app.services.ponto_diario_service import PontoDiarioService
+from app.services.rh_calculator_service import calcular_holerite, calcular_retrospectiva, limites_do_mes
+
+MES = "2026-03"
+
+
+@pytest.fixture
+def equipe(session):
+    from flask import g, has_request_context
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    admin = session.query(Funcionario).filter_by(estabelecimento_id=estab.id).first()
+    admin.nivel_acesso = 1
+    session.add(ConfiguracaoHorario(estabelecimento_id=estab.id, exigir_foto=False, exigir_localizacao=False,
+                                    hora_entrada=time(8, 0), tolerancia_entrada=10, jornada_diaria_minutos=480))
+    caixas = []
+    for i, salario in enumerate(("2000.00", "3500.00")):
+        f = Funcionario(
+            estabelecimento_id=estab.id, nome=f"Operador {i}", cpf=f"4440001{i:04d}", username=f"operador{i}",
+            role="FUNCIONARIO", nivel_acesso=5, ativo=True, data_nascimento=date(1995, 1, 1),
+            celular="92999999999", email=f"operador{i}@mercadinho.sys", cargo="Operador de Caixa",
+            data_admissao=date(2024, 1, 1), salario_base=Decimal(salario),
+        )
+        f.set_password("x")
+        session.add(f)
+        caixas.append(f)
+    session.flush()
+    vt = Beneficio(estabelecimento_id=estab.id, nome="Vale Transporte", valor_padrao=Decimal("180"))
+    session.add(vt)
+    session.flush()
+    session.add(FuncionarioBeneficio(estabelecimento_id=estab.id, funcionario_id=caixas[0].id,
+                                     beneficio_id=vt.id, valor=Decimal("180")))
+    # Operador 0: dia com 1h50 de extra e 20 min de atraso
+    for hora, tipo, atraso in ((time(8, 20), "entrada", 20), (time(12, 0), "saida_almoco", 0),
+                               (time(13, 0), "retorno_almoco", 0), (time(19, 10), "saida", 0)):
+        session.add(RegistroPonto(estabelecimento_id=estab.id, funcionario_id=caixas[0].id, data=date(2026, 3, 2),
+                                  hora=hora, tipo_registro=tipo, minutos_atraso=atraso,
+                                  status="atrasado" if atraso else "normal"))
+    session.commit()
+    PontoDiarioService.reconstruir(estabelecimento_id=estab.id)
+    headers = {"Authorization": "Bearer " + create_access_token(
+        identity=str(admin.id), additional_claims={"estabelecimento_id": estab.id, "role": "admin"})}
+    return estab, admin, caixas, headers
+
+
+def test_lote_bate_com_o_calculo_individual(equipe):
+    estab, admin, caixas, _ = equipe
+    proc = FolhaService.processar(estab.id, MES)
+    assert (proc.versao, proc.funcionarios, proc.recalculados) == (1, 3, 3)
+
+    inicio, fim = limites_do_mes(MES)
+    for f in caixas:
+        linha = FolhaService.item(estab.id, MES, f.id)
+        assert linha.holerite_json == calcular_holerite(f, MES)
+        assert linha.retrospectiva_json == calcular_retrospectiva(f, inicio, fim)
+    holerite = FolhaService.item(estab.id, MES, caixas[0].id).holerite_json
+    assert holerite["horas_extras_horas"] == 1.83 and round(holerite["atrasos_horas"], 2) == 0.33
+    assert any(v["descricao"] == "Vale Transporte" for v in holerite["vencimentos"])
+    assert float(proc.total_liquido) == pytest.approx(
+        sum(FolhaService.item(estab.id, MES, f.id).holerite_json["totais"]["liquido"] for f in [admin, *caixas]))
+
+    # Snapshot é imutável
+    proc.recalculados = 99
+    with pytest.raises(ValueError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_reprocessamento_recalcula_so_quem_mudou(equipe):
+    estab, admin, caixas, _ = equipe
+    v1 = FolhaService.processar(estab.id, MES)
+    assert FolhaService.processar(estab.id, MES).id == v1.id  # nada mudou: mesma versão
+
+    caixas[1].salario_base = Decimal("3800.00")
+    db.session.commit()
+    v2 = FolhaService.processar(estab.id, MES)
+    assert (v2.versao, v2.recalculados) == (2, 1)
+    recalculados = {i.funcionario_id for i in FolhaService.itens(v2) if i.recalculado}
+    assert recalculados == {caixas[1].id}
+    assert FolhaService.item(estab.id, MES, caixas[1].id).holerite_json["salario_base"] == 3800.0
+
+    # A versão anterior segue intacta
+    antiga = next(i for i in FolhaService.itens(v1) if i.funcionario_id == caixas[1].id)
+    assert antiga.holerite_json["salario_base"] == 3500.0
+
+    v3 = FolhaService.processar(estab.id, MES, forcar=[caixas[0].id])
+    assert (v3.versao, v3.recalculados) == (3, 1)
+    assert FolhaProcessamento.query.filter_by(estabelecimento_id=estab.id, mes_referencia=MES).count() == 3
+
+
+def test_rotas_servem_do_snapshot(client, equipe, monkeypatch):
+    estab, admin, caixas, headers = equipe
+    r = client.post("/api/rh/folha/processar", headers=headers, json={"mes_referencia": MES})
+    assert r.status_code == 200, r.get_json()
+    assert r.get_json()["data"]["versao"] == 1
+
+    import app.services.rh_calculator_service as calc
+
+    def _proibido(*args, **kwargs):
+        raise AssertionError("deveria servir do snapshot")
+    monkeypatch.setattr(calc, "calcular_holerite", _proibido)
+    monkeypatch.setattr(calc, "calcular_retrospectiva", _proibido)
+
+    r = client.get("/api/rh/holerite", headers=headers,
+                   query_string={"funcionario_id": caixas[0].id, "mes_referencia": MES})
+    corpo = r.get_json()
+    assert r.status_code == 200 and corpo["processamento"]["versao"] == 1
+    assert corpo["data"]["funcionario_id"] == caixas[0].id
+
+    r = client.get("/api/rh/retrospectiva", headers=headers,
+                   query_string={"funcionario_id": caixas[0].id, "ano_mes": MES})
+    assert r.status_code == 200 and r.get_json()["data"]["ponto"]["horas_extras"] == 1.83
+
+    r = client.get("/api/rh/provisoes", headers=headers, query_string={"ano_mes": MES})
+    corpo = r.get_json()
+    assert r.status_code == 200 and len(corpo["data"]) == 3 and corpo["processamento"]["versao"] == 1
+    assert next(p for p in corpo["data"] if p["funcionario_id"] == caixas[0].id)["beneficios"] == 180.0
+
+    folha = client.get(f"/api/rh/folha/{MES}", headers=headers).get_json()
+    assert {i["funcionario_id"] for i in folha["itens"]} == {admin.id, *(f.id for f in caixas)}
+    assert client.get("/api/rh/folha/2026-04", headers=headers).status_code == 404
@@ -0,0 +1,109 @@
+"""
+Snapshot analítico de fornecedores (fornecedores_metricas): mantido a cada
+mudança em pedidos de compra e contas a pagar, e usado por listagem, busca
+(nome sem acento / CNPJ) e estatísticas.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from flask import g, has_request_context
+from flask_jwt_extended import create_access_token
+
+from app.models import db, ContaPagar, Estabelecimento, Fornecedor, FornecedorMetrica, Funcionario, PedidoCompra
+from app.services.fornecedor_metricas_service import FornecedorMetricasService
+
+
+@pytest.fixture
+def ctx(session):
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    admin = session.query(Funcionario).filter_by(estabelecimento_id=estab.id).first()
+    endereco = dict(cep="69000-000", logradouro="Rua X", numero="1", bairro="Centro", cidade="Manaus", pais="Brasil")
+    acai = Fornecedor(estabelecimento_id=estab.id, nome_fantasia="Açaí do Norte", razao_social="Açaí Norte LTDA",
+                      cnpj="11222333000144", telefone="9233330000", email="vendas@acai.com", estado="AM", **endereco)
+    limpeza = Fornecedor(estabelecimento_id=estab.id, nome_fantasia="LimpaTudo", razao_social="LimpaTudo LTDA",
+                         cnpj="44555666000177", telefone="9233331111", email="forn@limpatudo.com", estado="PA", **endereco)
+    session.add_all([acai, limpeza])
+    session.commit()
+    token = create_access_token(identity=str(admin.id), additional_claims={
+        "estabelecimento_id": estab.id, "role": "admin",
+    })
+    return {"estab": estab, "admin": admin, "acai": acai, "limpeza": limpeza,
+            "headers": {"Authorization": f"Bearer {token}"}}
+
+
+def _pedido(ctx, numero, total, status):
+    return PedidoCompra(estabelecimento_id=ctx["estab"].id, fornecedor_id=ctx["acai"].id,
+                        funcionario_id=ctx["admin"].id, numero_pedido=numero, status=status,
+                        total=Decimal(total), data_pedido=datetime(2026, 7, int(numero[-1])))
+
+
+def test_snapshot_acompanha_pedidos_e_contas(session, ctx):
+    acai = ctx["acai"]
+    session.add_all([
+        _pedido(ctx, "PC-1", "60000", "recebido"),
+        _pedido(ctx, "PC-2", "1500", "pendente"),
+        _pedido(ctx, "PC-3", "999", "cancelado"),
+        ContaPagar(estabelecimento_id=ctx["estab"].id, fornecedor_id=acai.id, numero_documento="DUP-1",
+                   valor_original=Decimal("800"), valor_atual=Decimal("800"),
+                   data_emissao=date(2026, 7, 1), data_vencimento=date(2026, 8, 1)),
+    ])
+    session.commit()
+
+    m = FornecedorMetrica.query.filter_by(fornecedor_id=acai.id).one()
+    assert (m.total_pedidos, m.pedidos_recebidos) == (2, 1)
+    assert float(m.valor_comprado) == 60000.0
+    assert m.classificacao == "A"
+    assert m.ultima_compra == datetime(2026, 7, 2)
+    assert (m.contas_abertas, float(m.valor_em_aberto)) == (1, 800.0)
+
+    conta = ContaPagar.query.filter_by(numero_documento="DUP-1").one()
+    conta.status = "pago"
+    session.commit()
+    db.session.refresh(m)
+    assert (m.contas_abertas, float(m.valor_em_aberto)) == (0, 0.0)
+
+    # UPSERT por fornecedor_id: a linha é atualizada no lugar, nunca apagada e reinserida
+    linha_id = m.id
+    assert FornecedorMetricasService.recalcular([acai.id, acai.id]) == 1
+    assert FornecedorMetrica.query.filter_by(fornecedor_id=acai.id).one().id == linha_id
+
+    assert FornecedorMetrica.query.filter_by(fornecedor_id=ctx["limpeza"].id).one().classificacao == "NOVO"
+
+
+def test_listagem_e_busca_sem_acento_e_por_cnpj(client, ctx):
+    headers = ctx["headers"]
+    resp = client.get("/api/fornecedores?busca=acai", headers=headers)
+    body = resp.get_json()
+    assert resp.status_code == 200, body
+    assert [f["nome_fantasia"] for f in body["fornecedores"]] == ["Açaí do Norte"]
+    assert body["fornecedores"][0]["classificacao"] == "NOVO"
+    assert body["fornecedores"][0]["produtos_ativos"] == 0
+
+    resp = client.get("/api/fornecedores/busca?q=44.555", headers=headers)
+    assert [f["nome_fantasia"] for f in resp.get_json()["fornecedores"]] == ["LimpaTudo"]
+
+    # Snapshot ausente (ex.: logo após a migração) é reconstruído na primeira leitura.
+    db.session.execute(FornecedorMetrica.__table__.delete())
+    db.session.commit()
+    FornecedorMetricasService.invalidar()
+    resp = client.get("/api/fornecedores/busca?q=limpa", headers=headers)
+    assert [f["nome_fantasia"] for f in resp.get_json()["fornecedores"]] == ["LimpaTudo"]
+
+
+def test_estatisticas_do_snapshot(client, session, ctx):
+    session.add(_pedido(ctx, "PC-1", "120000", "concluido"))
+    session.commit()
+
+    resp = client.get("/api/fornecedores/estatisticas", headers=ctx["headers"])
+    body = resp.get_json()
+    assert resp.status_code == 200, body
+    stats = body["estatisticas"]
+    assert (stats["total"], stats["ativos"]) == (2, 2)
+    assert stats["classificacoes"] == {"PREMIUM": 1, "NOVO": 1}
+    assert stats["por_estado"] == {"AM": 1, "PA": 1}
+    assert body["top_fornecedores"][0] == {
+        "id": ctx["acai"].id, "nome": "Açaí do Norte", "valor_total": 120000.0, "total_compras": 1,
+    }
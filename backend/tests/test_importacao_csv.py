@@ -0,0 +1,147 @@
+"""
+Importação em massa via CSV: leitura em blocos, duplicados resolvidos com uma
+consulta por bloco, INSERT ... ON CONFLICT em lote, erros por linha, simulação
+e retomada de um job interrompido.
+"""
+import io
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import func, select
+
+from app.models import (
+    db, Auditoria, CategoriaProduto, Cliente, ContaReceber, Estabelecimento, Funcionario, ImportacaoArquivo,
+    Produto, ProdutoLote, utcnow,
+)
+from app.services import importacao_service
+from app.services.importacao_service import ImportacaoService, ImportadorProdutos
+
+
+@pytest.fixture
+def loja(app, session, tmp_path):
+    app.config["IMPORTACAO_FOLDER"] = str(tmp_path)
+    estab = session.query(Estabelecimento).first()
+    func_ = db.session.execute(select(Funcionario).filter_by(estabelecimento_id=estab.id)).scalars().first()
+    headers = {"Authorization": "Bearer " + create_access_token(
+        identity=str(func_.id), additional_claims={"estabelecimento_id": estab.id, "role": "admin"})}
+    return estab, headers
+
+
+def _enviar(client, url, headers, conteudo, codificacao="utf-8", **opcoes):
+    dados = {"arquivo": (io.BytesIO(conteudo.encode(codificacao)), "carga.csv"), **opcoes}
+    return client.post(url, headers=headers, data=dados, content_type="multipart/form-data")
+
+
+def _contar(modelo, **filtros):
+    return db.session.execute(select(func.count()).select_from(modelo).filter_by(**filtros)).scalar()
+
+
+def test_produtos_em_blocos_com_erros_por_linha(client, session, loja, monkeypatch):
+    estab, headers = loja
+    monkeypatch.setattr(importacao_service, "_LOTE", 2)
+    bebidas = CategoriaProduto(estabelecimento_id=estab.id, nome="Bebidas")
+    session.add(bebidas)
+    session.flush()
+    session.add(Produto(estabelecimento_id=estab.id, categoria_id=bebidas.id, nome="Água", codigo_barras="7890000000001",
+                        preco_custo=Decimal("1"), preco_venda=Decimal("2")))
+    session.commit()
+
+    csv_ = ("Nome;Categoria;EAN;Preço Custo;Preço Venda;Estoque;Lote;Validade\n"
+            "Suco Uva;Bebidas;7891000000002;3,50;5,90;12;L-01;31/12/2027\n"
+            "Sabão em Pó;Limpeza;;8;12,00;0;;\n"
+            "Suco Uva 2;Bebidas;7891000000002;3;5;1;;\n"       # EAN repetido no arquivo
+            "Água Nova;Bebidas;7890000000001;1;2;0;;\n"        # EAN já cadastrado na loja
+            "Sem Preço;Bebidas;;1;;0;;\n"
+            ";;;;;;;\n")
+    resp = _enviar(client, "/api/produtos/importar", headers, csv_, codificacao="latin-1")
+    corpo = resp.get_json()
+    assert resp.status_code == 200, corpo
+    job = corpo["importacao"]
+    assert (job["status"], job["inseridos"], job["rejeitados"], job["total_linhas"]) == ("concluido", 2, 3, 6)
+    assert corpo["total_importados"] == 2 and corpo["total_erros"] == 3
+    assert [e["linha"] for e in job["erros"]] == [4, 5, 6]
+    assert "repetido no arquivo (linha 2)" in job["erros"][0]["erro"]
+    assert "já cadastrado" in job["erros"][1]["erro"]
+
+    suco = db.session.execute(select(Produto).filter_by(codigo_barras="7891000000002")).scalar_one()
+    assert suco.preco_venda == Decimal("5.9") and suco.controlar_validade and suco.sync_uuid
+    lote = db.session.execute(select(ProdutoLote).filter_by(produto_id=suco.id)).scalar_one()
+    assert lote.numero_lote == "L-01" and lote.quantidade == 12
+    assert _contar(CategoriaProduto, estabelecimento_id=estab.id, nome="Limpeza") == 1
+    assert _contar(Auditoria, estabelecimento_id=estab.id, tipo_evento="produto_importado") == 1
+
+    # atualizar=true: o EAN existente vira atualização (preço), o resto segue as mesmas regras
+    resp = _enviar(client, "/api/produtos/importar", headers,
+                   "nome,categoria,ean,preco_venda\nÁgua Gelada,Bebidas,7890000000001,2.50\n", atualizar="true")
+    job = resp.get_json()["importacao"]
+    assert (job["inseridos"], job["atualizados"]) == (0, 1)
+    agua = db.session.execute(select(Produto).filter_by(codigo_barras="7890000000001")).scalar_one()
+    db.session.refresh(agua)
+    assert agua.nome == "Água Gelada" and agua.preco_venda == Decimal("2.5")
+
+
+def test_clientes_simulados_e_confirmados_sem_reenvio(client, session, loja):
+    estab, headers = loja
+    session.add(Cliente(estabelecimento_id=estab.id, nome="Ana", cpf="529.982.247-25", celular="(92) 99999-0001",
+                        cep="69000-000", logradouro="Rua A", numero="1", bairro="Centro", cidade="Manaus", estado="AM"))
+    session.commit()
+    csv_ = ("nome;cpf;celular;saldo_devedor;limite_credito\n"
+            "Bruno;111.444.777-35;92999990002;150,00;500\n"
+            "Carla;123;;0;0\n"
+            "Ana Maria;52998224725;;0;800\n")
+
+    resp = _enviar(client, "/api/clientes/importar", headers, csv_, simular="sim")
+    job = resp.get_json()["importacao"]
+    assert job["simulacao"] and (job["inseridos"], job["rejeitados"]) == (1, 2)
+    assert _contar(Cliente, estabelecimento_id=estab.id) == 1  # nada gravado
+
+    resp = client.post(f"/api/clientes/importar/{job['handle']}/confirmar", headers=headers)
+    job = resp.get_json()["importacao"]
+    assert resp.status_code == 200 and not job["simulacao"] and job["inseridos"] == 1
+    bruno = db.session.execute(select(Cliente).filter_by(cpf="111.444.777-35")).scalar_one()
+    assert bruno.celular == "(92) 99999-0002" and bruno.logradouro == "Não informado" and bruno.estado == "AM"
+    conta = db.session.execute(select(ContaReceber).filter_by(cliente_id=bruno.id)).scalar_one()
+    assert conta.valor_atual == Decimal("150") and conta.numero_documento == f"MIG-{bruno.id}"
+    assert client.post(f"/api/clientes/importar/{job['handle']}/confirmar", headers=headers).status_code == 409
+
+    # atualizar=true não troca o endereço gravado pelos marcadores de campo vazio
+    resp = _enviar(client, "/api/clientes/importar", headers, csv_, atualizar="1")
+    job = resp.get_json()["importacao"]
+    assert (job["inseridos"], job["atualizados"], job["rejeitados"]) == (0, 2, 1)
+    ana = db.session.execute(select(Cliente).filter_by(cpf="529.982.247-25")).scalar_one()
+    db.session.refresh(ana)
+    assert ana.nome == "Ana Maria" and ana.limite_credito == 800 and ana.logradouro == "Rua A"
+    assert ana.celular == "(92) 99999-0001"
+    assert client.get(job["status_url"], headers=headers).get_json()["importacao"]["status"] == "concluido"
+
+
+def test_job_interrompido_retoma_do_bloco_seguinte(client, session, loja, monkeypatch):
+    estab, headers = loja
+    monkeypatch.setattr(importacao_service, "_LOTE", 3)
+    original = ImportadorProdutos.processar
+    chamadas = []
+
+    def _cai_no_segundo_bloco(self, bloco):
+        chamadas.append(len(bloco))
+        if len(chamadas) == 2:
+            raise ConnectionError("conexão perdida")
+        return original(self, bloco)
+    monkeypatch.setattr(ImportadorProdutos, "processar", _cai_no_segundo_bloco)
+
+    linhas = "".join(f"Item {i};Geral;;1;2;0\n" for i in range(7))  # sem EAN: repetir duplicaria
+    resp = _enviar(client, "/api/produtos/importar", headers, "nome;categoria;ean;preco_custo;preco_venda;estoque\n" + linhas)
+    job = resp.get_json()["importacao"]
+    assert resp.status_code == 202 and job["status"] == "pendente"
+    assert (job["linhas_processadas"], job["inseridos"]) == (3, 3) and "conexão perdida" in job["ultimo_erro"]
+
+    registro = db.session.execute(select(ImportacaoArquivo).filter_by(handle=job["handle"])).scalar_one()
+    registro.proxima_tentativa_em = utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert ImportacaoService.processar_pendentes() == {"concluido": 1}
+    assert chamadas == [3, 3, 3, 1]
+    assert _contar(Produto, estabelecimento_id=estab.id) == 7
+
+    resp = _enviar(client, "/api/produtos/importar", headers, "descricao;valor\nx;1\n")
+    assert resp.status_code == 400 and "nome, categoria, preco_venda" in resp.get_json()["message"]
@@ -0,0 +1,103 @@
+"""
+Login rápido: funcionário + estabelecimento + plano em UMA consulta, histórico
+de login gravado em lote fora da resposta e vazão medida sob concorrência.
+"""
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from flask import g, has_request_context
+from sqlalchemy import event
+
+from app.models import db, Estabelecimento, Funcionario, LoginHistory
+from app.services.auth_service import AuthService, LoginHistoryWriter
+
+
+@pytest.fixture
+def caixa_operador(session):
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    user = Funcionario(
+        estabelecimento_id=estab.id, nome="Operador Turno", cpf="55566677788",
+        username="operador_turno", role="CAIXA", status="ativo", ativo=True,
+        data_nascimento=date(1995, 5, 5), celular="92988887777",
+        email="operador_turno@teste.sys", cargo="Operador de Caixa",
+        data_admissao=date(2024, 1, 1), salario_base=Decimal("1500.00"),
+    )
+    user.set_password("turno123")
+    session.add(user)
+    session.commit()
+    AuthService.invalidar()
+    return {"estab_id": estab.id, "user_id": user.id, "plano": estab.plano}
+
+
+def test_login_resolve_funcionario_e_tenant_em_uma_consulta(client, caixa_operador):
+    selects = []
+
+    def _conta(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", _conta)
+    try:
+        resp = client.post("/api/auth/login", json={"identifier": "OPERADOR_TURNO", "senha": "turno123"})
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _conta)
+
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    user = resp.get_json()["data"]["user"]
+    assert user["id"] == caixa_operador["user_id"]
+    assert user["estabelecimento_id"] == caixa_operador["estab_id"]
+    assert len(selects) == 1
+    assert "JOIN estabelecimentos" in selects[0]
+
+
+def test_falha_de_login_entra_no_historico(client, caixa_operador):
+    resp = client.post("/api/auth/login", json={"identifier": "operador_turno", "senha": "errada"})
+    assert resp.status_code == 401
+
+    falha = LoginHistory.query.filter_by(funcionario_id=caixa_operador["user_id"]).one()
+    assert falha.success is False
+
+
+def test_writer_grava_historico_em_lote(app, caixa_operador):
+    writer = LoginHistoryWriter(app)
+    writer.start()
+    for i in range(5):
+        writer.enfileirar({
+            "funcionario_id": caixa_operador["user_id"], "username": "operador_turno",
+            "estabelecimento_id": caixa_operador["estab_id"], "ip_address": "10.0.0.1",
+            "user_agent": "PDV", "success": True, "contexto": "local",
+        })
+    writer.aguardar()
+
+    assert LoginHistory.query.filter_by(funcionario_id=caixa_operador["user_id"]).count() == 5
+
+
+def test_bench_login_reporta_vazao(app, caixa_operador):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=[
+        "bench-login", "--username", "operador_turno", "--senha", "turno123",
+        "--total", "6", "--concorrencia", "3",
+    ])
+    assert result.exit_code == 0, result.output
+    assert "6/6 OK" in result.output
+    assert "logins/s" in result.output
+
+
+def test_contexto_cacheado_segue_edicoes_de_funcionario_e_loja(session, caixa_operador):
+    ctx = AuthService.contexto(caixa_operador["user_id"])
+    assert ctx["ativo"] is True
+
+    loja = db.session.get(Estabelecimento, caixa_operador["estab_id"])
+    loja.plano_status = "suspenso"
+    session.commit()
+    assert AuthService.contexto(caixa_operador["user_id"])["estab_plano_status"] == "suspenso"
+
+    user = db.session.get(Funcionario, caixa_operador["user_id"])
+    user.ativo = False
+    session.commit()
+    assert AuthService.contexto(caixa_operador["user_id"])["ativo"] is False
+    assert AuthService.buscar_para_login("operador_turno", apenas_ativos=True) is None
+    assert AuthService.buscar_para_login("operador_turno")["id"] == caixa_operador["user_id"]
@@ -0,0 +1,94 @@
+"""
+Particionamento mensal (particionamento_service): DDL das partições, predicados
+de janela na chave de partição (janela_particionada) usados pelos agregados de
+giro/ABC e fallback no SQLite, onde não há particionamento nativo.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from app.models import (
+    db, CategoriaProduto, Estabelecimento, Funcionario, MovimentacaoEstoque, Pagamento, Produto, Venda, VendaItem,
+    janela_particionada, utcnow, FOLGA_PARTICAO_FILHA,
+)
+from app.services.particionamento_service import (
+    ParticionamentoService, com_chave, ddl_particao, meses, somar_meses,
+)
+from app.utils import giro_cache
+
+
+@pytest.fixture
+def loja(session):
+    from flask import g, has_request_context
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    admin = session.query(Funcionario).filter_by(estabelecimento_id=estab.id).first()
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Bebidas")
+    session.add(cat)
+    session.flush()
+    produtos = [Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome=nome, preco_custo=Decimal("1"),
+                        preco_venda=Decimal("3"), quantidade=100) for nome in ("Água", "Suco")]
+    session.add_all(produtos)
+    session.commit()
+    giro_cache._cache.clear()
+    return estab, admin, produtos
+
+
+def test_ddl_e_calendario_das_particoes():
+    assert meses(date(2025, 11, 20), date(2026, 2, 1)) == [
+        date(2025, 11, 1), date(2025, 12, 1), date(2026, 1, 1), date(2026, 2, 1)]
+    assert somar_meses(date(2026, 11, 1), 3) == date(2027, 2, 1)
+    assert ddl_particao("vendas", date(2026, 12, 1)) == (
+        "CREATE TABLE IF NOT EXISTS vendas_p202612 PARTITION OF vendas "
+        "FOR VALUES FROM ('2026-12-01') TO ('2027-01-01')")
+    assert com_chave("UNIQUE (estabelecimento_id, codigo)", "data_venda") == \
+        "UNIQUE (estabelecimento_id, codigo, data_venda)"
+    assert com_chave("CREATE UNIQUE INDEX ux ON public.pagamentos USING btree (venda_id) WHERE (valor > 0)",
+                     "created_at") == \
+        "CREATE UNIQUE INDEX ux ON public.pagamentos USING btree (venda_id, created_at) WHERE (valor > 0)"
+    assert ParticionamentoService.tabelas() == {
+        "vendas": "data_venda", "venda_itens": "created_at", "pagamentos": "created_at",
+        "movimentacoes_estoque": "created_at"}
+
+
+def test_janela_na_chave_de_particao_nos_agregados(loja):
+    estab, admin, (agua, suco) = loja
+    agora = utcnow()
+    for n, (produto, dias) in enumerate(((agua, 10), (agua, 80), (suco, 120))):
+        quando = agora - timedelta(days=dias)
+        venda = Venda(estabelecimento_id=estab.id, funcionario_id=admin.id, codigo=f"P{n}", subtotal=6, total=6,
+                      status="finalizada", data_venda=quando)
+        venda.itens.append(VendaItem(estabelecimento_id=estab.id, produto_id=produto.id, produto_nome=produto.nome,
+                                     quantidade=2, preco_unitario=3, total_item=6, created_at=quando))
+        db.session.add(venda)
+    db.session.commit()
+
+    inicio = agora - timedelta(days=90)
+    pai, = janela_particionada(Venda, inicio)
+    assert (str(pai.left), pai.right.value) == ("vendas.data_venda", inicio)
+    filho, = janela_particionada(VendaItem, inicio, agora)  # filho: só limite inferior, com folga
+    assert (str(filho.left), filho.right.value) == ("venda_itens.created_at", inicio - FOLGA_PARTICAO_FILHA)
+    assert len(janela_particionada(MovimentacaoEstoque, date(2026, 1, 1), agora)) == 2
+    assert janela_particionada(Pagamento, None) == []
+
+    agregado = giro_cache.get_vendas_agregadas(estab.id)
+    assert set(agregado) == {agua.id} and agregado[agua.id]["qtd"] == 4.0
+    assert set(Produto.calcular_classificacao_abc_dinamica(estab.id, periodo_dias=90)) == {agua.id}
+
+
+def test_sqlite_sem_particionamento_nativo(app, loja):
+    assert ParticionamentoService.suportado() is False
+    assert ParticionamentoService.particionadas() == []
+    assert ParticionamentoService.listar("vendas") == []
+    assert ParticionamentoService.manter() == {}
+    assert ParticionamentoService.converter("vendas") == {
+        "tabela": "vendas", "convertida": False, "motivo": "particionamento nativo exige Postgres"}
+    with pytest.raises(ValueError):
+        ParticionamentoService.converter("produtos")
+
+    runner = app.test_cli_runner()
+    assert "não é Postgres" in runner.invoke(args=["particionar-tabelas"]).output
+    assert "Nenhuma tabela particionada" in runner.invoke(args=["manter-particoes"]).output
+    assert "AAAA-MM" in runner.invoke(args=["arquivar-particoes", "--antes-de", "2026"]).output
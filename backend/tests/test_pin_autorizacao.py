@@ -0,0 +1,122 @@
+"""
+Autorização por PIN (pin_service): candidato achado pela chave HMAC indexada e
+verificado com um único hash, migração dos PINs antigos no primeiro uso e
+bloqueio de tentativas por operador (e caixa aberto do tenant).
+"""
+from datetime import date
+from decimal import Decimal
+
+from flask_jwt_extended import create_access_token
+from werkzeug.security import generate_password_hash
+
+from app.models import db, Estabelecimento, Funcionario
+from app.services.pin_service import PinService, chave_busca
+
+
+def _loja(session, gerentes=0):
+    from flask import g, has_request_context
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():  # guard multi-tenant fail-closed, como em test_pin_seguranca
+        g.estabelecimento_id = estab.id
+    admin = session.query(Funcionario).filter_by(estabelecimento_id=estab.id).first()
+    admin.nivel_acesso = 1
+    for i in range(gerentes):
+        gerente = Funcionario(
+            estabelecimento_id=estab.id, nome=f"Gerente {i}", cpf=f"5550001{i:04d}", username=f"gerente{i}",
+            role="gerente", nivel_acesso=2, ativo=True, data_nascimento=date(1990, 1, 1), celular="92999999999",
+            email=f"gerente{i}@mercadinho.sys", cargo="Gerente", data_admissao=date(2024, 1, 1),
+            salario_base=Decimal("3000"),
+        )
+        gerente.set_password("x")
+        gerente.set_pin(f"{7000 + i}")
+        session.add(gerente)
+    db.session.commit()
+    return estab, admin
+
+
+def _headers(estab_id, caixa=None, operador="1"):
+    headers = {"Authorization": "Bearer " + create_access_token(
+        identity=operador, additional_claims={"estabelecimento_id": estab_id, "role": "admin", "nivel_acesso": 1})}
+    if caixa:
+        headers["X-Caixa-Id"] = str(caixa)
+    return headers
+
+
+def _contar_hashes(monkeypatch):
+    chamadas = []
+    original = Funcionario.check_pin
+
+    def _check(self, pin):
+        chamadas.append(self.id)
+        return original(self, pin)
+    monkeypatch.setattr(Funcionario, "check_pin", _check)
+    return chamadas
+
+
+def test_busca_indexada_verifica_um_unico_hash(client, session, monkeypatch):
+    estab, admin = _loja(session, gerentes=6)
+    admin.set_pin("4321")
+    db.session.commit()
+    assert admin.pin_busca == chave_busca(estab.id, "4321") and "4321" not in admin.pin_busca
+    assert "pin_busca" not in admin.to_dict()
+    chamadas = _contar_hashes(monkeypatch)
+
+    r = client.post("/api/configuracao/verificar-pin", json={"pin": "4321"}, headers=_headers(estab.id))
+    assert r.status_code == 200 and r.get_json()["autorizador"] == admin.nome
+    assert chamadas == [admin.id]
+
+    # PIN errado com todos migrados: nenhum hash lento é calculado
+    chamadas.clear()
+    r = client.post("/api/configuracao/verificar-pin", json={"pin": "9999"}, headers=_headers(estab.id))
+    assert r.status_code == 403 and chamadas == []
+
+    # A chave depende do tenant: o mesmo PIN em outra loja não casa
+    assert chave_busca(estab.id + 1, "4321") != admin.pin_busca
+
+
+def test_pin_antigo_migra_no_primeiro_uso_e_na_troca_de_pepper(app, client, session, monkeypatch):
+    estab, admin = _loja(session, gerentes=2)
+    admin.pin_cancelamento = generate_password_hash("2468")  # gravado antes da coluna pin_busca
+    admin.pin_busca = None
+    db.session.commit()
+    assert PinService.pendentes_migracao(estab.id) == 1
+
+    r = client.post("/api/configuracao/verificar-pin", json={"pin": "2468"}, headers=_headers(estab.id))
+    assert r.status_code == 200
+    db.session.refresh(admin)
+    assert admin.pin_busca == chave_busca(estab.id, "2468")
+    assert PinService.pendentes_migracao(estab.id) == 0
+
+    chamadas = _contar_hashes(monkeypatch)
+    assert PinService.autorizar(estab.id, "2468").id == admin.id and chamadas == [admin.id]
+
+    # Pepper novo: chaves antigas viram pendentes e migram do mesmo jeito
+    monkeypatch.setitem(app.config, "PIN_PEPPER", "pepper-rotacionado")
+    assert PinService.pendentes_migracao(estab.id) == 3
+    assert PinService.autorizar(estab.id, "7001").username == "gerente1"
+    assert PinService.pendentes_migracao(estab.id) == 2
+
+
+def test_bloqueio_de_tentativas_por_operador(client, session, monkeypatch):
+    monkeypatch.setenv("PIN_MAX_TENTATIVAS", "3")
+    estab, admin = _loja(session)
+    admin.set_pin("1357")
+    db.session.commit()
+    url = "/api/configuracao/verificar-pin"
+
+    for _ in range(3):
+        assert client.post(url, json={"pin": "0000"}, headers=_headers(estab.id, caixa=7)).status_code == 403
+    r = client.post(url, json={"pin": "1357"}, headers=_headers(estab.id, caixa=7))
+    assert r.status_code == 429 and 0 < int(r.headers["Retry-After"]) <= 300
+
+    # Trocar o X-Caixa-Id (caixa inexistente/fechado) não abre contagem nova
+    for caixa in (8, None):
+        assert client.post(url, json={"pin": "1357"}, headers=_headers(estab.id, caixa=caixa)).status_code == 429
+
+    # Outro operador segue liberado, e acertar zera a contagem dele
+    outro = _headers(estab.id, operador="2")
+    assert client.post(url, json={"pin": "0000"}, headers=outro).status_code == 403
+    assert client.post(url, json={"pin": "1357"}, headers=outro).status_code == 200
+    for _ in range(2):
+        assert client.post(url, json={"pin": "0000"}, headers=outro).status_code == 403
+    assert client.post(url, json={"pin": "1357"}, headers=outro).status_code == 200
@@ -0,0 +1,169 @@
+"""
+Planos das consultas quentes por tenant + período: cada caminho abaixo roda a
+função real, as instruções emitidas são capturadas e o EXPLAIN de cada uma não
+pode varrer inteira uma tabela de alto volume nem chegar nela só pelo índice do
+tenant (query_helpers.acessos_do_plano). Um filtro de período que volte a
+embrulhar a coluna (func.date, EXTRACT) ou um índice composto removido derruba
+o teste.
+"""
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import event
+
+from app.models import (
+    db, Auditoria, ContaPagar, ContaReceber, Despesa, Estabelecimento, Funcionario, MovimentacaoEstoque,
+    PedidoVenda, RegistroPonto, Venda,
+)
+from app.services.folha_service import FolhaService
+from app.services.rh_calculator_service import calcular_retrospectiva
+from app.utils import giro_cache
+from app.utils.query_helpers import acessos_do_plano, filtro_mes, filtro_periodo
+from app.utils.timezone import intervalo_utc
+
+TABELAS_QUENTES = {
+    "vendas", "venda_itens", "pagamentos", "movimentacoes_estoque", "contas_pagar", "contas_receber",
+    "despesas", "registros_ponto", "auditoria", "pedidos_venda", "entregas",
+}
+
+
+@contextmanager
+def _capturar():
+    capturadas = []
+
+    def _anotar(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            capturadas.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", _anotar)
+    try:
+        yield capturadas
+    finally:
+        event.remove(engine, "before_cursor_execute", _anotar)
+
+
+def _so_tenant(tabela, indice, colunas):
+    if colunas is None:  # Postgres: só o nome do índice
+        return indice == f"ix_{tabela}_estabelecimento_id"
+    return colunas == ("estabelecimento_id",)
+
+
+def _varreduras(capturadas):
+    """{sql: [tabelas quentes lidas inteiras ou filtradas no índice só pelo tenant]}"""
+    ruins = {}
+    for sql, params in capturadas:
+        quentes = {tabela for tabela, indice, colunas in acessos_do_plano(sql, params)
+                   if tabela in TABELAS_QUENTES and (indice is None or _so_tenant(tabela, indice, colunas))}
+        if quentes:
+            ruins[sql] = sorted(quentes)
+    return ruins
+
+
+# Valores distintos por coluna numa loja grande (o resto — ids, datas — é quase único)
+_DISTINTOS = {"estabelecimento_id": 2, "status": 5, "tipo": 8, "tipo_evento": 20, "forma_pagamento": 6,
+              "categoria": 30, "produto_id": 5_000, "funcionario_id": 50}
+_LINHAS = 1_000_000
+
+
+def _estatisticas_de_producao():
+    """sqlite_stat1 com a forma de uma base em produção: sem isso o planner
+    do SQLite (tabelas vazias) escolhe índices por heurística, não por custo."""
+    conn = db.session.connection()
+    conn.exec_driver_sql("ANALYZE")
+    conn.exec_driver_sql("DELETE FROM sqlite_stat1")
+    for tabela in TABELAS_QUENTES:
+        for indice in conn.exec_driver_sql(f"PRAGMA index_list({tabela})").all():
+            colunas = [c[2] for c in conn.exec_driver_sql(f"PRAGMA index_info({indice[1]})")]
+            stat, distintos = [_LINHAS], 1
+            for coluna in colunas:
+                distintos *= _DISTINTOS.get(coluna, _LINHAS // 10)
+                stat.append(max(1, _LINHAS // distintos))
+            conn.exec_driver_sql("INSERT INTO sqlite_stat1 VALUES (?, ?, ?)",
+                                 (tabela, indice[1], " ".join(map(str, stat))))
+    conn.exec_driver_sql("ANALYZE sqlite_schema")
+
+
+@pytest.fixture
+def loja(session):
+    from flask import g, has_request_context
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    giro_cache._cache.clear()
+    _estatisticas_de_producao()
+    yield estab, session.query(Funcionario).filter_by(estabelecimento_id=estab.id).first()
+    db.session.rollback()
+    db.session.connection().exec_driver_sql("DROP TABLE IF EXISTS sqlite_stat1")
+    db.session.commit()
+
+
+def test_faixa_semiaberta_no_dia_local():
+    de, ate = intervalo_utc(date(2026, 3, 1), "2026-03-31")
+    assert (de, ate) == (datetime(2026, 3, 1, 3), datetime(2026, 4, 1, 3))  # APP_UTC_OFFSET_HOURS=-3
+    assert intervalo_utc(None, datetime(2026, 3, 1, 23, 59)) == (None, datetime(2026, 3, 2, 3))
+
+    # Coluna Date compara com a própria data; DateTime com o instante UTC
+    despesa = filtro_periodo(Despesa.data_despesa, date(2026, 2, 1), date(2026, 2, 28))
+    assert [c.right.value for c in despesa.clauses] == [date(2026, 2, 1), date(2026, 3, 1)]
+    mes = filtro_mes(Venda.data_venda, 2026, 2)
+    assert [c.right.value for c in mes.clauses] == [datetime(2026, 2, 1, 3), datetime(2026, 3, 1, 3)]
+    assert "date(" not in str(mes).lower()
+
+
+def test_filtros_de_periodo_usam_indice_composto(loja):
+    estab, _ = loja
+    de, ate = date(2026, 1, 1), date(2026, 1, 31)
+    consultas = [
+        db.session.query(Venda.id).filter(Venda.estabelecimento_id == estab.id,
+                                          filtro_periodo(Venda.data_venda, de, ate), Venda.status == "finalizada"),
+        db.session.query(MovimentacaoEstoque.id).filter(MovimentacaoEstoque.estabelecimento_id == estab.id,
+                                                        filtro_periodo(MovimentacaoEstoque.created_at, de, ate)),
+        db.session.query(ContaPagar.id).filter(ContaPagar.estabelecimento_id == estab.id,
+                                               filtro_periodo(ContaPagar.data_vencimento, de, ate)),
+        db.session.query(ContaReceber.id).filter(ContaReceber.estabelecimento_id == estab.id,
+                                                 filtro_periodo(ContaReceber.data_vencimento, de, ate)),
+        db.session.query(Despesa.id).filter(Despesa.estabelecimento_id == estab.id,
+                                            filtro_periodo(Despesa.data_despesa, de, ate)),
+        db.session.query(RegistroPonto.id).filter(RegistroPonto.estabelecimento_id == estab.id,
+                                                  filtro_periodo(RegistroPonto.data, de, ate)),
+        db.session.query(Auditoria.id).filter(Auditoria.estabelecimento_id == estab.id,
+                                              filtro_periodo(Auditoria.data_evento, de, ate)),
+        db.session.query(PedidoVenda.id).filter(PedidoVenda.estabelecimento_id == estab.id,
+                                                filtro_mes(PedidoVenda.data_emissao, 2026, 1)),
+    ]
+    with _capturar() as capturadas:
+        for q in consultas:
+            q.all()
+    assert len(capturadas) == len(consultas)
+    assert _varreduras(capturadas) == {}
+
+    # Sanidade do harness: o formato antigo (função na coluna) é pego
+    with _capturar() as capturadas:
+        db.session.query(Despesa.id).filter(db.func.date(Despesa.created_at) == date(2026, 1, 5)).all()
+    assert list(_varreduras(capturadas).values()) == [["despesas"]]
+
+
+def test_caminhos_quentes_sem_varredura_completa(client, loja):
+    from flask_jwt_extended import create_access_token
+    from app.dashboard_cientifico.data_layer import DataLayer
+
+    estab, funcionario = loja
+    headers = {"Authorization": "Bearer " + create_access_token(
+        identity=str(funcionario.id), additional_claims={"estabelecimento_id": estab.id, "role": "admin"})}
+    inicio, fim = date(2026, 1, 1), date(2026, 1, 31)
+    with _capturar() as capturadas:
+        FolhaService._atividade(estab.id, inicio, fim)
+        calcular_retrospectiva(funcionario, inicio, fim)
+        giro_cache.get_vendas_agregadas(estab.id)
+        DataLayer.get_sales_timeseries(estab.id, 30)
+        DataLayer.get_sales_financials(estab.id, datetime(2026, 1, 1), datetime(2026, 1, 31))
+        DataLayer.get_payment_methods_metrics(estab.id, datetime(2026, 1, 1), datetime(2026, 1, 31))
+        assert client.get("/api/vendas/estatisticas", headers=headers, query_string={
+            "data_inicio": "2026-01-01", "data_fim": "2026-01-31"}).status_code == 200
+        assert client.get("/api/delivery/stats", headers=headers).status_code == 200
+        assert client.get("/api/delivery/dashboard", headers=headers, query_string={
+            "data_inicio": "2026-01-01", "data_fim": "2026-01-31"}).status_code == 200
+    assert len(capturadas) > 10
+    assert _varreduras(capturadas) == {}
@@ -0,0 +1,108 @@
+"""
+Consolidado diário do ponto (PontoDiario): mantido a cada batida/ajuste/exclusão
+com a regra do espelho, e estatísticas, relatórios e espelho servidos por
+agrupamento sobre ele.
+"""
+from datetime import date, time, timedelta
+
+from sqlalchemy import select
+
+from app.models import db, PontoDiario, RegistroPonto
+from app.services.ponto_diario_service import PontoDiarioService, dias_uteis
+from app.services.rh_calculator_service import calcular_espelho_ponto
+
+
+def _bater(client, headers, dia, hora, tipo):
+    r = client.post("/api/ponto/registrar", headers=headers, json={
+        "tipo_registro": tipo, "data_local": dia.isoformat(), "hora_local": hora})
+    assert r.status_code == 201, r.get_json()
+    return r.get_json()["data"]["id"]
+
+
+def _linha(func_id, dia):
+    return db.session.execute(select(PontoDiario).filter_by(funcionario_id=func_id, data=dia)).scalar_one_or_none()
+
+
+def test_batidas_ajuste_e_exclusao_mantem_o_dia(client, loja_ponto):
+    estab, func_, headers = loja_ponto
+    hoje = date.today()
+    _bater(client, headers, hoje, "08:25", "entrada")
+    linha = _linha(func_.id, hoje)
+    assert linha.presente and linha.entrada_atrasada and linha.minutos_atraso_entrada == 25
+    assert linha.minutos_trabalhados == 0
+
+    _bater(client, headers, hoje, "12:00", "saida_almoco")
+    _bater(client, headers, hoje, "13:00", "retorno_almoco")
+    saida_id = _bater(client, headers, hoje, "18:40", "saida")
+    db.session.refresh(linha)
+    assert (linha.batidas, linha.minutos_trabalhados, linha.minutos_extras) == (4, 555, 75)  # 10h15 - 1h almoço
+
+    r = client.put(f"/api/ponto/{saida_id}", headers=headers, json={"hora": "17:25:00"})
+    assert r.status_code == 200
+    db.session.refresh(linha)
+    assert (linha.ultima_saida, linha.minutos_trabalhados, linha.minutos_extras) == (time(17, 25), 480, 0)
+
+    # Jornada nova reaplica a hora extra no histórico consolidado
+    r = client.put("/api/ponto/configuracao", headers=headers, json={"jornada_diaria_minutos": 420})
+    assert r.status_code == 200
+    db.session.refresh(linha)
+    assert linha.minutos_extras == 60
+
+    assert client.delete("/api/ponto/teste/limpar-hoje", headers=headers).status_code == 200
+    assert _linha(func_.id, hoje) is None
+
+
+def test_estatisticas_e_relatorio_agrupam_o_consolidado(client, loja_ponto):
+    estab, func_, headers = loja_ponto
+    hoje = date.today()
+    ontem = hoje - timedelta(days=1)
+    for dia, entrada in ((ontem, "08:00"), (hoje, "08:30")):
+        _bater(client, headers, dia, entrada, "entrada")
+        _bater(client, headers, dia, "17:30", "saida")
+
+    dados = client.get("/api/ponto/estatisticas", headers=headers).get_json()["data"]
+    assert (dados["dias_trabalhados"], dados["total_atrasos"], dados["minutos_atraso_total"]) == (2, 1, 30)
+    assert dados["frequencia_tipo"] == {"entrada": 2, "saida_almoco": 0, "retorno_almoco": 0, "saida": 2}
+    grafico = {p["data"]: p for p in dados["grafico_frequencia"]}
+    assert grafico[hoje.isoformat()]["teve_atraso"] and grafico[ontem.isoformat()]["total_registros"] == 2
+
+    r = client.get("/api/ponto/relatorio/funcionarios", headers=headers,
+                   query_string={"data_inicio": ontem.isoformat(), "data_fim": hoje.isoformat()})
+    corpo = r.get_json()["data"]
+    linha = next(f for f in corpo["funcionarios"] if f["funcionario_id"] == func_.id)
+    assert (linha["dias_trabalhados"], linha["total_registros"], linha["minutos_extras"]) == (2, 4, 150)
+    assert linha["faltas"] == max(0, dias_uteis(ontem, hoje) - 2)
+
+    espelho = calcular_espelho_ponto(func_, ontem, hoje)
+    assert espelho["resumo"]["total_dias_trabalhados"] == 2
+    assert espelho["resumo"]["total_minutos_extras"] == 150 and espelho["resumo"]["total_minutos_atraso"] == 30
+
+
+def test_reconstruir_historico_a_partir_das_batidas(session, loja_ponto):
+    estab, func_, _ = loja_ponto
+    dia = date(2026, 3, 2)  # segunda-feira
+    for hora, tipo, atraso in ((time(8, 15), "entrada", 15), (time(12, 0), "saida_almoco", 0),
+                               (time(13, 30), "retorno_almoco", 20), (time(18, 0), "saida", 0)):
+        session.add(RegistroPonto(estabelecimento_id=estab.id, funcionario_id=func_.id, data=dia, hora=hora,
+                                  tipo_registro=tipo, minutos_atraso=atraso,
+                                  status="atrasado" if atraso else "normal"))
+    session.commit()
+    assert _linha(func_.id, dia) is None  # inserido por fora do fluxo (histórico)
+
+    assert PontoDiarioService.reconstruir(estabelecimento_id=estab.id) == 1
+    linha = _linha(func_.id, dia)
+    assert (linha.minutos_trabalhados, linha.minutos_atraso, linha.batidas_atrasadas) == (495, 35, 2)
+    assert PontoDiarioService.reconstruir(estabelecimento_id=estab.id) == 1  # idempotente
+
+    # O upgrade da migração consolida o mesmo histórico (tabela vazia → mesmas linhas)
+    import importlib.util, pathlib
+    arquivo = next(pathlib.Path(__file__).parent.parent.glob("migrations/versions/f4b6d8e0a2c3_*.py"))
+    spec = importlib.util.spec_from_file_location("migracao_ponto_diario", arquivo)
+    migracao = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migracao)
+    session.query(PontoDiario).delete()
+    migracao._consolidar_historico(session.connection())
+    session.commit()
+    linha = _linha(func_.id, dia)
+    assert (linha.minutos_trabalhados, linha.minutos_atraso, linha.batidas_atrasadas) == (495, 35, 2)
+    assert dias_uteis(date(2026, 3, 2), date(2026, 3, 8)) == 5 and dias_uteis(dia, dia, trabalha_sabado=True) == 1
@@ -0,0 +1,156 @@
+"""
+Motor RFM em lote: o cálculo roda em UMA consulta agrupada (não uma por cliente),
+os scores ficam persistidos em clientes_rfm e as telas/relatórios leem dali.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from flask import g, has_request_context
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app.models import db, Estabelecimento, Funcionario, Cliente, ClienteRFM, Venda
+from app.services.rfm_service import RFMService
+from app.tasks.rfm_task import RFMTask
+
+
+def _cliente(estab_id, i):
+    return Cliente(
+        estabelecimento_id=estab_id, nome=f"Cliente {i:02d}", cpf=f"000000000{i:02d}",
+        celular="92999990000", cep="69000-000", logradouro="Rua RFM", numero=str(i),
+        bairro="Centro", cidade="Manaus", estado="AM",
+    )
+
+
+@pytest.fixture
+def base_rfm(session):
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    admin = Funcionario.query.first()
+
+    clientes = [_cliente(estab.id, i) for i in range(1, 11)]
+    session.add_all(clientes)
+    session.flush()
+
+    agora = datetime.utcnow()
+    n = 0
+    # Cliente i compra i vezes, de R$ 10*i cada, a última há (11 - i) dias:
+    # o cliente 10 é o mais recente, frequente e valioso; o cliente 1 o oposto.
+    for i, c in enumerate(clientes, start=1):
+        for k in range(i):
+            n += 1
+            session.add(Venda(
+                estabelecimento_id=estab.id, funcionario_id=admin.id, cliente_id=c.id,
+                codigo=f"V-RFM-{n}", subtotal=Decimal(10 * i), total=Decimal(10 * i),
+                status="finalizada", data_venda=agora - timedelta(days=(11 - i) + 20 * k),
+            ))
+    session.commit()
+    return {"estab": estab, "admin": admin, "clientes": clientes}
+
+
+def test_calculo_em_lote_usa_uma_consulta(base_rfm, app):
+    estab_id = base_rfm["estab"].id
+    cliente_ids = [c.id for c in base_rfm["clientes"]]
+    selects = []
+
+    def _conta(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", _conta)
+    try:
+        metricas = RFMService.calcular_metricas(estab_id)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _conta)
+
+    assert len(metricas) == 10
+    assert len(selects) == 1
+
+    por_cliente = {m["cliente_id"]: m for m in metricas}
+    melhor = por_cliente[cliente_ids[-1]]
+    pior = por_cliente[cliente_ids[0]]
+    assert (melhor["recency_score"], melhor["frequency_score"], melhor["monetary_score"]) == (5, 5, 5)
+    assert melhor["segmento"] == "Campeão"
+    assert (pior["recency_score"], pior["frequency_score"], pior["monetary_score"]) == (1, 1, 1)
+    assert pior["segmento"] == "Perdido"
+
+
+def test_empates_recebem_o_mesmo_quintil(session, base_rfm):
+    estab = base_rfm["estab"]
+    admin = base_rfm["admin"]
+    agora = datetime.utcnow()
+    extras = [_cliente(estab.id, 50 + i) for i in range(4)]
+    session.add_all(extras)
+    session.flush()
+    for i, c in enumerate(extras):
+        session.add(Venda(
+            estabelecimento_id=estab.id, funcionario_id=admin.id, cliente_id=c.id,
+            codigo=f"V-TIE-{i}", subtotal=Decimal("10"), total=Decimal("10"),
+            status="finalizada", data_venda=agora - timedelta(days=30),
+        ))
+    session.commit()
+
+    metricas = {m["cliente_id"]: m for m in RFMService.calcular_metricas(estab.id)}
+    scores = {metricas[c.id]["frequency_score"] for c in extras}
+    assert len(scores) == 1
+
+
+def test_snapshot_persistido_alimenta_rotas(client, base_rfm):
+    estab = base_rfm["estab"]
+    admin = base_rfm["admin"]
+
+    assert RFMService.recalcular_estabelecimento(estab.id) == 10
+    assert ClienteRFM.query.filter_by(estabelecimento_id=estab.id).count() == 10
+    calculado_em = ClienteRFM.query.first().calculado_em
+
+    token = create_access_token(identity=str(admin.id), additional_claims={
+        "estabelecimento_id": estab.id, "role": "admin",
+    })
+    headers = {"Authorization": f"Bearer {token}"}
+
+    resp = client.get("/api/clientes/rfm", headers=headers)
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    rfm = resp.get_json()["rfm"]
+    assert len(rfm["customers"]) == 10
+    assert sum(rfm["segments"].values()) == 10
+
+    resp = client.get("/api/relatorios/rfm/clientes", headers=headers)
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    body = resp.get_json()
+    assert body["total_clientes"] == 10
+    assert body["clientes"][0]["segmento"] == "Campeão"
+
+    # Leitura não recalculou: o snapshot continua o mesmo.
+    assert ClienteRFM.query.first().calculado_em == calculado_em
+
+    risco = RFMService.obter_clientes_em_risco(estab.id)
+    assert risco and all(c["segmento"] in RFMService.SEGMENTOS_RISCO for c in risco)
+
+
+def test_leitura_nao_grava_e_janelas_nao_se_sobrescrevem(app, client, base_rfm):
+    estab = base_rfm["estab"]
+    token = create_access_token(identity=str(base_rfm["admin"].id), additional_claims={
+        "estabelecimento_id": estab.id, "role": "admin",
+    })
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # Sem snapshot: a tela calcula na hora e não grava nada
+    resp = client.get("/api/clientes/rfm", headers=headers)
+    assert resp.status_code == 200 and len(resp.get_json()["rfm"]["customers"]) == 10
+    assert ClienteRFM.query.count() == 0
+
+    # O agendador grava a janela padrão
+    assert RFMTask.run(app) == 10
+    calculado_em = ClienteRFM.query.first().calculado_em
+
+    # Janela de 30 dias: calculada na hora, o snapshot de 180 continua intacto
+    resp = client.get("/api/clientes/rfm?dias=30", headers=headers)
+    rfm = resp.get_json()["rfm"]
+    assert resp.status_code == 200 and rfm["window_days"] == 30
+    assert max(c["frequency"] for c in rfm["customers"]) == 2  # compras a cada 20 dias
+    assert {r.janela_dias for r in ClienteRFM.query.all()} == {RFMService.JANELA_DIAS}
+    assert ClienteRFM.query.first().calculado_em == calculado_em
+    assert RFMService.calcular_rfm_cliente(base_rfm["clientes"][-1].id, estab.id, 30)["frequency"] == 2
+    assert RFMService.calcular_rfm_cliente(base_rfm["clientes"][-1].id, estab.id)["frequency"] == 9  # 10ª compra fica fora dos 180 dias
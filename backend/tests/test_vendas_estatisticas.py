@@ -0,0 +1,105 @@
+"""
+Estatísticas de vendas sobre data_venda normalizada: filtros de período
+sargáveis (índice estabelecimento/data/status), agregados numa passada e
+tendência ajustada com NumPy.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app.models import db, CategoriaProduto, Estabelecimento, Funcionario, Pagamento, Produto, Venda, VendaItem
+
+
+@pytest.fixture
+def loja(session):
+    from flask import g, has_request_context
+    estab = session.query(Estabelecimento).first()
+    if has_request_context():
+        g.estabelecimento_id = estab.id
+    estab.plano = "Pro"
+    admin = session.query(Funcionario).filter_by(estabelecimento_id=estab.id).first()
+    cat = CategoriaProduto(estabelecimento_id=estab.id, nome="Padaria")
+    session.add(cat)
+    session.flush()
+    produto = Produto(estabelecimento_id=estab.id, categoria_id=cat.id, nome="Pão", preco_custo=Decimal("1"),
+                      preco_venda=Decimal("2"), quantidade=1000)
+    session.add(produto)
+    session.commit()
+    headers = {"Authorization": "Bearer " + create_access_token(
+        identity=str(admin.id), additional_claims={"estabelecimento_id": estab.id, "role": "admin"})}
+    return estab, admin, produto, headers
+
+
+def _venda(estab, admin, produto, quando, total, forma="dinheiro"):
+    codigo = f"V{Venda.query.count() + len(db.session.new) + 1}"
+    venda = Venda(estabelecimento_id=estab.id, funcionario_id=admin.id, codigo=codigo,
+                  subtotal=total, total=total, status="finalizada", data_venda=quando)
+    venda.itens.append(VendaItem(estabelecimento_id=estab.id, produto_id=produto.id, produto_nome=produto.nome,
+                                 quantidade=total / 2, preco_unitario=2, total_item=total,
+                                 margem_lucro_real=total / 2))
+    venda.pagamentos.append(Pagamento(estabelecimento_id=estab.id, forma_pagamento=forma, valor=total,
+                                      status="aprovado"))
+    db.session.add(venda)
+    return venda
+
+
+def test_estatisticas_numa_passada_com_previsao(client, loja):
+    estab, admin, produto, headers = loja
+    inicio = datetime(2026, 3, 1, 15, 0)
+    for dia in range(10):
+        _venda(estab, admin, produto, inicio + timedelta(days=dia), 10 * (dia + 1))
+    sem_data = _venda(estab, admin, produto, None, 4)
+    db.session.commit()
+    assert sem_data.data_venda is not None  # normalizada no flush
+
+    r = client.get("/api/vendas/estatisticas", headers=headers,
+                   query_string={"data_inicio": "2026-03-01T00:00:00", "data_fim": "2026-03-31T00:00:00"})
+    corpo = r.get_json()
+    assert r.status_code == 200, corpo
+    gerais = corpo["estatisticas_gerais"]
+    assert (gerais["quantidade_vendas"], gerais["total_valor"], gerais["total_lucro"]) == (10, 550.0, 275.0)
+    assert [d["total"] for d in corpo["vendas_por_dia"]] == [10.0 * n for n in range(1, 11)]
+    assert corpo["vendas_por_hora"] == [{"hora": 15, "quantidade": 10, "total": 550.0}]
+    assert [p["total"] for p in corpo["previsao_vendas"][:2]] == [110.0, 120.0]
+    assert corpo["previsao_vendas"][0]["data"] == "2026-03-11"
+
+    # Filtro de período em data_venda usa o índice composto
+    plano = db.session.execute(db.text(
+        "EXPLAIN QUERY PLAN SELECT id FROM vendas WHERE estabelecimento_id = :e "
+        "AND data_venda >= :i AND status = 'finalizada'"), {"e": estab.id, "i": inicio}).all()
+    assert any("ix_venda_estab_data_status" in str(linha) for linha in plano)
+
+
+def test_tendencia_semanal_em_uma_agregacao(client, loja):
+    estab, admin, produto, headers = loja
+    agora = datetime.now()
+    for semanas, total in ((0, 40), (1, 30), (2, 20), (3, 10)):
+        _venda(estab, admin, produto, agora - timedelta(days=7 * semanas + 1), total)
+    db.session.commit()
+
+    r = client.get("/api/vendas/analise-tendencia", headers=headers, query_string={"periodo": "semanal", "meses": 1})
+    corpo = r.get_json()
+    assert r.status_code == 200, corpo
+    assert [(x["quantidade"], x["total"]) for x in corpo["resultados"]] == [(1, 40.0), (1, 30.0), (1, 20.0), (1, 10.0)]
+    assert corpo["tendencia"] == {"inclinacao": 10.0, "direcao": "alta"}
+    assert corpo["resultados"][0]["crescimento"] == pytest.approx(33.33)
+
+
+def test_relatorio_diario_agrega_itens_no_banco(client, loja):
+    estab, admin, produto, headers = loja
+    dia = datetime(2026, 3, 2)
+    _venda(estab, admin, produto, dia.replace(hour=10), 8)
+    _venda(estab, admin, produto, dia.replace(hour=14), 12, forma="Pix")
+    _venda(estab, admin, produto, dia + timedelta(days=1, hours=10), 50)
+    db.session.commit()
+
+    r = client.get("/api/vendas/relatorio-diario", headers=headers, query_string={"data": "2026-03-02"})
+    corpo = r.get_json()
+    assert r.status_code == 200, corpo
+    assert corpo["resumo"]["total_vendas"] == 20.0
+    assert corpo["produtos_mais_vendidos"] == [
+        {"produto_id": produto.id, "nome": "Pão", "quantidade": 10.0, "total": 20.0}]
+    assert [(v["hora"], v["quantidade_itens"]) for v in corpo["vendas"]] == [("14:00", 1), ("10:00", 1)]
+    assert set(corpo["formas_pagamento"]) == {"dinheiro", "pix"}
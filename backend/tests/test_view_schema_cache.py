@@ -0,0 +1,93 @@
+"""
+View Schema compilado: artefato versionado no cache compartilhado, invalidação
+por carimbo (vale para todos os workers) e ETag/304 no endpoint.
+"""
+from flask_jwt_extended import create_access_token
+
+from app.models import Estabelecimento
+from app.services import view_schema_service as vs
+
+
+def _contar_montagens(monkeypatch):
+    chamadas = []
+    original = vs._montar_view_schema
+
+    def _montar(*args, **kwargs):
+        chamadas.append(args)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(vs, "_montar_view_schema", _montar)
+    return chamadas
+
+
+def test_artefato_compilado_uma_vez_e_recompilado_quando_overrides_mudam(session, monkeypatch):
+    estab = session.query(Estabelecimento).first()
+    estab.segmento = "mercearia"
+    session.commit()
+    montagens = _contar_montagens(monkeypatch)
+
+    primeiro = vs.compilar_view_schema(estab, familia_produto="alimento")
+    for _ in range(5):
+        assert vs.resolver_view_schema(estab, familia_produto="alimento") is primeiro.schema
+    assert len(montagens) == 1
+    assert primeiro.etag and '"campos"' in primeiro.json
+
+    # Overrides mudam o hash do contexto: nova chave, novo artefato, novo ETag
+    estab.configuracoes = {"view_schema": {"campos_ocultos": ["marca"]}}
+    session.commit()
+    segundo = vs.compilar_view_schema(estab, familia_produto="alimento")
+    assert len(montagens) == 2 and segundo.etag != primeiro.etag
+    assert "marca" not in {c["chave"] for c in segundo.schema["campos"]}
+
+    # Atributos validados com os índices do artefato
+    limpos = vs.sanitizar_atributos(segundo.schema, {"desconhecido": "x", "embalagem": " Caixa "})
+    assert "desconhecido" not in limpos
+    assert vs.campos_de_atributo(segundo.schema) is segundo.atributos_por_tipo["produto"]
+
+
+def test_carimbo_de_versao_propaga_entre_workers(session, monkeypatch):
+    estab = session.query(Estabelecimento).first()
+    montagens = _contar_montagens(monkeypatch)
+    artefato = vs.compilar_view_schema(estab)
+
+    # "Outro worker": memória local vazia, mesmo cache compartilhado → só desserializa
+    with vs._artefatos_lock:
+        vs._artefatos.clear()
+    outro = vs.compilar_view_schema(estab)
+    assert len(montagens) == 1 and outro.etag == artefato.etag and outro.schema is not artefato.schema
+
+    # Invalidação feita "em outro worker" (só troca o carimbo no cache): este
+    # processo para de usar o artefato em memória na próxima resolução
+    vs.invalidar_cache_view_schema(estab.id)
+    vs.compilar_view_schema(estab)
+    assert len(montagens) == 2
+    vs.invalidar_cache_view_schema()
+    vs.compilar_view_schema(estab)
+    vs.compilar_view_schema(segmento="vestuario")
+    assert len(montagens) == 4
+
+
+def test_endpoint_responde_304_enquanto_o_schema_nao_muda(client, session):
+    estab = session.query(Estabelecimento).first()
+    token = create_access_token(identity="1", additional_claims={"estabelecimento_id": estab.id, "role": "admin"})
+    headers = {"Authorization": f"Bearer {token}"}
+
+    resp = client.get("/api/view-schema/?familia_produto=alimento", headers=headers)
+    assert resp.status_code == 200 and resp.get_json()["success"]
+    etag = resp.headers["ETag"]
+    assert "no-cache" in resp.headers["Cache-Control"]
+
+    resp = client.get("/api/view-schema/?familia_produto=alimento", headers={**headers, "If-None-Match": etag})
+    assert resp.status_code == 304 and not resp.data
+
+    outra = client.get("/api/view-schema/?familia_produto=bebida", headers={**headers, "If-None-Match": etag})
+    assert outra.status_code == 200 and outra.headers["ETag"] != etag
+
+    assert client.put("/api/view-schema/overrides", json={"campos_ocultos": ["marca"]},
+                      headers=headers).status_code == 200
+    resp = client.get("/api/view-schema/?familia_produto=alimento", headers={**headers, "If-None-Match": etag})
+    assert resp.status_code == 200 and resp.headers["ETag"] != etag
+    assert "marca" not in {c["chave"] for c in resp.get_json()["schema"]["campos"]}
+
+    base = client.get("/api/view-schema/?base=1", headers=headers)
+    assert base.status_code == 200 and base.get_json()["overrides"]["campos_ocultos"] == ["marca"]
+    assert client.get("/api/view-schema/?base=1", headers={**headers, "If-None-Match": base.headers["ETag"]}).status_code == 304